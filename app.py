@@ -152,6 +152,15 @@ if not database_url.startswith("sqlite"):
 app.config["MAX_CONTENT_LENGTH"] = 500 * 1024 * 1024  # 500 MB - لدعم رفع عدد كبير من الصور
 app.config["UPLOAD_FOLDER"] = "uploads"
 
+# تقديم الملفات المرفوعة: تفويض الإرسال للخادم الأمامي ومدة التخزين المؤقت
+app.config["USE_X_SENDFILE"] = os.environ.get("USE_X_SENDFILE", "").lower() in ("1", "true", "yes")
+app.config["UPLOADS_ACCEL_REDIRECT"] = os.environ.get("UPLOADS_ACCEL_REDIRECT")
+app.config["UPLOADS_CACHE_MAX_AGE"] = int(os.environ.get("UPLOADS_CACHE_MAX_AGE", 86400))
+
+# بث الإشعارات (SSE) يشغل عاملاً لكل صفحة مفتوحة؛ يُفعَّل فقط مع عمال gevent أو gthread
+app.config["NOTIFICATIONS_STREAM_ENABLED"] = os.environ.get("NOTIFICATIONS_STREAM_ENABLED", "").lower() in ("1", "true", "yes")
+app.config["LIVE_LOCATIONS_STREAM_ENABLED"] = os.environ.get("LIVE_LOCATIONS_STREAM_ENABLED", "").lower() in ("1", "true", "yes")
+
 # Initialize SQLAlchemy with the app
 db.init_app(app)
 
@@ -183,8 +192,9 @@ app.config['FIREBASE_APP_ID'] = os.environ.get('FIREBASE_APP_ID')
 
 @login_manager.user_loader
 def load_user(user_id):
-    from models import User
-    return User.query.get(int(user_id))
+    # من ذاكرة المستخدمين بين الطلبات (بدون استعلام إلا عند أول طلب أو بعد تعديل المستخدم)
+    from services import user_cache
+    return user_cache.load(int(user_id))
 
 # إضافة فلتر nl2br لتحويل السطور الجديدة إلى وسوم HTML <br>
 from markupsafe import Markup
@@ -359,6 +369,10 @@ with app.app_context():
     # Import models before creating tables
     import models  # noqa: F401
     import models_accounting  # noqa: F401
+    import services.ledger_balances  # noqa: F401  أحداث تحديث أرصدة الحسابات عند حفظ القيود
+    import services.user_cache  # noqa: F401  أحداث إسقاط ذاكرة المستخدمين وصلاحياتهم
+    import services.search_index  # noqa: F401  أحداث تحديث فهرس البحث عند حفظ الموظفين والمركبات والوثائق
+    import services.share_packages  # noqa: F401  أحداث إسقاط محتوى حزم مشاركة العمليات
 
     # Import and register route blueprints
     from routes.dashboard import dashboard_bp
@@ -410,6 +424,7 @@ with app.app_context():
     from routes.attendance_api import attendance_api_bp
     from routes.api_accident_reports import api_accident_reports
     from routes.database_backup import database_backup_bp
+    from routes.mobile_uploads import mobile_uploads_bp
 
     # تعطيل حماية CSRF لطرق معينة
     csrf.exempt(voicehub_bp)
@@ -464,6 +479,7 @@ with app.app_context():
     app.register_blueprint(drive_browser_bp, url_prefix='/drive')  # مستعرض Google Drive
     app.register_blueprint(attendance_api_bp)  # API الحضور
     app.register_blueprint(api_accident_reports)  # API تقارير حوادث السيارات
+    app.register_blueprint(mobile_uploads_bp)  # الرفع المجزأ القابل للاستئناف للجوال
     
     # استيراد وتسجيل مسار صفحة الهبوط - مسار منفصل عن النظام
     from routes.landing import landing_bp
@@ -488,45 +504,24 @@ with app.app_context():
     # Database Backup - النسخ الاحتياطي
     app.register_blueprint(database_backup_bp, url_prefix='/backup')
 
-    @app.route('/uploads/<path:filename>')
-    def uploaded_file(filename):
-        from flask import send_from_directory, abort, Response
-        from utils.storage_helper import download_image
-        import os
+    def _serve_uploaded_file(filename, roots):
+        from flask import send_from_directory, abort
+        from utils.storage_helper import cache_object_locally
+        from utils.image_pipeline import variant_path
+        from utils.file_serving import serve_upload
         
-        # البحث أولاً في uploads
-        file_path = os.path.join("uploads", filename)
-        if os.path.exists(file_path):
-            dir_parts = filename.split("/")
-            if len(dir_parts) > 1:
-                subdir = "/".join(dir_parts[:-1])
-                file_name = dir_parts[-1]
-                return send_from_directory(f"uploads/{subdir}", file_name)
-            else:
-                return send_from_directory("uploads", filename)
+        # النسخة المصغرة عند طلبها (?size=thumb أو ?size=medium)؛ إذا لم تُنشأ بعد يُرسل
+        # الأصل بتخزين مؤقت قصير حتى لا يحتفظ المتصفح به مكان النسخة
+        provisional = False
+        if request.args.get('size'):
+            variant = variant_path(filename, request.args['size'])
+            provisional = variant == filename
+            filename = variant
         
-        # البحث في static/uploads كنسخة احتياطية
-        static_file_path = os.path.join("static", "uploads", filename)
-        if os.path.exists(static_file_path):
-            dir_parts = filename.split("/")
-            if len(dir_parts) > 1:
-                subdir = "/".join(dir_parts[:-1])
-                file_name = dir_parts[-1]
-                return send_from_directory(f"static/uploads/{subdir}", file_name)
-            else:
-                return send_from_directory("static/uploads", filename)
-        
-        # البحث في Object Storage
-        image_data = download_image(filename)
-        if image_data:
-            ext = filename.lower().rsplit('.', 1)[-1]
-            content_types = {
-                'jpg': 'image/jpeg', 'jpeg': 'image/jpeg',
-                'png': 'image/png', 'gif': 'image/gif',
-                'webp': 'image/webp', 'svg': 'image/svg+xml'
-            }
-            content_type = content_types.get(ext, 'image/jpeg')
-            return Response(image_data, mimetype=content_type)
+        # البحث في المجلدات المحلية ثم Object Storage (يُنزّل مرة واحدة إلى القرص)
+        response = serve_upload(filename, roots, fallback=cache_object_locally, provisional=provisional)
+        if response is not None:
+            return response
         
         # في حالة عدم وجود الصورة، إرجاع صورة بديلة
         if filename.lower().endswith(('.png', '.jpg', '.jpeg', '.gif', '.webp')):
@@ -534,41 +529,13 @@ with app.app_context():
         
         abort(404)
 
+    @app.route('/uploads/<path:filename>')
+    def uploaded_file(filename):
+        return _serve_uploaded_file(filename, ('uploads', os.path.join('static', 'uploads')))
+
     @app.route('/static/uploads/<path:filename>')
     def static_uploaded_file(filename):
-        from flask import send_from_directory, abort, Response
-        from utils.storage_helper import download_image
-        import os
-        
-        # البحث في static/uploads
-        file_path = os.path.join('static', 'uploads', filename)
-        if os.path.exists(file_path):
-            dir_parts = filename.split('/')
-            if len(dir_parts) > 1:
-                subdir = '/'.join(dir_parts[:-1])
-                file_name = dir_parts[-1]
-                return send_from_directory(f'static/uploads/{subdir}', file_name)
-            else:
-                return send_from_directory('static/uploads', filename)
-        
-        # البحث في Object Storage
-        image_data = download_image(filename)
-        if image_data:
-            ext = filename.lower().rsplit('.', 1)[-1]
-            content_types = {
-                'jpg': 'image/jpeg', 'jpeg': 'image/jpeg',
-                'png': 'image/png', 'gif': 'image/gif',
-                'webp': 'image/webp', 'svg': 'image/svg+xml'
-            }
-            content_type = content_types.get(ext, 'image/jpeg')
-            return Response(image_data, mimetype=content_type)
-        
-        # في حالة عدم وجود الصورة، إرجاع صورة بديلة
-        if filename.lower().endswith(('.png', '.jpg', '.jpeg', '.gif', '.webp')):
-            return send_from_directory('static/images', 'image-not-found.svg')
-        
-        abort(404)
-        abort(404)
+        return _serve_uploaded_file(filename, (os.path.join('static', 'uploads'),))
 
     # إضافة دوال مساعدة لقوالب Jinja
     from utils.user_helpers import get_role_display_name, get_module_display_name, format_permissions, check_module_access
@@ -577,6 +544,10 @@ with app.app_context():
     from utils.id_encoder import register_template_filters
     register_template_filters(app)
 
+    # فلتر النسخ المصغرة للصور المرفوعة
+    from utils.image_pipeline import register_template_filters as register_image_filters
+    register_image_filters(app)
+
     # إضافة مرشح bitwise_and لاستخدامه في قوالب Jinja2
     @app.template_filter('bitwise_and')
     def bitwise_and_filter(value1, value2):
@@ -619,6 +590,10 @@ with app.app_context():
     except Exception as e:
         logger.info(f"Database tables already exist: {str(e)}")
 
+# سجل المراجعة: سجلات كل طلب تُكتب دفعة واحدة بعد انتهائه
+from services import audit_writer
+audit_writer.init_app(app)
+
 @app.before_request
 def before_request():
     # تعيين اللغة الافتراضية للعربية
@@ -698,6 +673,296 @@ def make_all_users_admins_command():
         print("تم التراجع عن كل التغييرات.")
 
 
+@app.cli.command("dedupe-uploads")
+@click.option('--dry-run', is_flag=True, help='عرض النتيجة بدون تعديل الملفات')
+@click.option('--root', default=None, help='المجلد المراد فحصه (افتراضياً static/uploads)')
+def dedupe_uploads_command(dry_run, root):
+    """
+    إزالة الملفات المكررة من static/uploads باستبدالها بروابط صلبة لنسخة واحدة.
+    المسارات المخزنة في قاعدة البيانات لا تتغير.
+    """
+    from services.blob_store import BlobStore, UPLOADS_ROOT
+
+    report = BlobStore.dedupe_tree(root or UPLOADS_ROOT, dry_run=dry_run)
+    print(f"الملفات المفحوصة: {report['scanned']}")
+    print(f"مجموعات مكررة: {report['duplicate_groups']} - ملفات مكررة: {report['duplicates']}")
+    print(f"{'المساحة القابلة للاسترداد' if dry_run else 'المساحة المستردة'}: "
+          f"{report['reclaimed_bytes'] / (1024 * 1024):.2f} MB")
+    if report['errors']:
+        print(f"أخطاء: {report['errors']}")
+
+
+@app.cli.command("blobs-gc")
+@click.option('--confirm', is_flag=True, help='تنفيذ الحذف فعلياً (بدونه يتم العرض فقط)')
+def blobs_gc_command(confirm):
+    """حذف ملفات المخزن التي لم يعد يشير إليها أي سجل في الجداول (يتطلب تأكيد المدير)"""
+    from services.blob_store import BlobStore
+
+    count, reclaimed = BlobStore.collect_garbage(dry_run=not confirm)
+    print(f"{'تم حذف' if confirm else 'سيتم حذف'} {count} ملف - {reclaimed / (1024 * 1024):.2f} MB")
+
+
+@app.cli.command("email-queue-send")
+@click.option('--limit', default=None, type=int, help='الحد الأقصى لعدد الإيميلات في الدفعة')
+def email_queue_send_command(limit):
+    """إرسال الإيميلات المستحقة في قائمة الإرسال الآن"""
+    from services.email_queue import deliver_due, BATCH_SIZE
+
+    stats = deliver_due(limit=limit or BATCH_SIZE)
+    print(f"تم الإرسال: {stats['sent']} - مؤجل: {stats['retry']} - فشل: {stats['failed']}")
+
+
+@app.cli.command("email-queue-import")
+@click.option('--directory', default='emails_queue', help='مجلد الإيميلات القديمة (ملفات JSON)')
+@click.option('--send', is_flag=True, help='استيرادها بحالة "في الانتظار" لإرسالها (افتراضياً بحالة فشل)')
+def email_queue_import_command(directory, send):
+    """استيراد الإيميلات المحفوظة كملفات في النظام القديم إلى جدول قائمة الإرسال"""
+    from services.email_queue import EmailQueue, STATUS_QUEUED, STATUS_FAILED
+
+    imported, skipped = EmailQueue.import_legacy_directory(directory, STATUS_QUEUED if send else STATUS_FAILED)
+    print(f"تم استيراد {imported} إيميل - تم تجاوز {skipped}")
+
+
+@app.cli.command("drive-sync")
+@click.option('--limit', default=None, type=int, help='الحد الأقصى لعدد الملفات في الدفعة')
+@click.option('--retry-failed', is_flag=True, help='إعادة الملفات الفاشلة إلى القائمة قبل الرفع')
+def drive_sync_command(limit, retry_failed):
+    """رفع الملفات المستحقة في قائمة المزامنة إلى Google Drive الآن"""
+    from services import drive_sync
+    from models import DriveSyncJob
+
+    if retry_failed:
+        for job in DriveSyncJob.query.filter_by(status=drive_sync.STATUS_FAILED).all():
+            drive_sync.retry(job)
+        db.session.commit()
+
+    stats = drive_sync.sync_due(limit=limit or drive_sync.BATCH_SIZE)
+    print(f"تم الرفع: {stats['done']} - مؤجل: {stats['retry']} - فشل: {stats['failed']}")
+    print(f"حالة القائمة: {drive_sync.status_counts()}")
+
+
+@app.cli.command("drive-cache")
+@click.option('--clear', is_flag=True, help='مسح ذاكرة مجلدات وملفات Drive بالكامل')
+def drive_cache_command(clear):
+    """تحديث ذاكرة Drive من سجل التغييرات (أو مسحها)"""
+    from services import drive_cache
+    from services.drive_sync import configured_client
+
+    if clear:
+        drive_cache.clear()
+        print("تم مسح ذاكرة Drive")
+        return
+
+    client = configured_client()
+    if client is None:
+        print("Google Drive غير مكوّن")
+        return
+    print(f"عناصر متغيرة: {drive_cache.sync_changes(client)}")
+
+
+@app.cli.command("db-backup")
+@click.argument('output')
+@click.option('--incremental', is_flag=True, help='نسخ ما تغيّر وما حُذف منذ آخر نسخة فقط')
+@click.option('--table', 'tables', multiple=True, help='جدول محدد (يمكن تكراره، افتراضياً كل الجداول)')
+@click.option('--batch-size', default=None, type=int, help='عدد السجلات المقروءة في كل دفعة')
+def db_backup_command(output, incremental, tables, batch_size):
+    """كتابة نسخة احتياطية متدفقة (ZIP من ملفات NDJSON مضغوطة) إلى OUTPUT"""
+    from services.backup_engine import export_archive
+
+    _, manifest = export_archive(list(tables) or None, batch_size=batch_size, dest=output,
+                                 kind='incremental' if incremental else 'full')
+    for name, info in manifest['tables'].items():
+        print(f"{name}: {info['count']}{'' if info['since'] else ' (كامل)'}")
+    print(f"سجلات محذوفة: {manifest['tombstones']['count']}")
+    print(f"تم حفظ النسخة ({manifest['kind']}) في {output}")
+
+
+@app.cli.command("db-restore")
+@click.argument('paths', nargs=-1, required=True)
+@click.option('--mode', type=click.Choice(['add', 'merge', 'replace']), default='add', help='طريقة الاستيراد')
+@click.option('--table', 'tables', multiple=True, help='جدول محدد (يمكن تكراره)')
+@click.option('--batch-size', default=None, type=int, help='عدد السجلات في كل أمر إدخال')
+@click.option('--workers', default=None, type=int, help='عدد الجداول المحملة بالتوازي')
+def db_restore_command(paths, mode, tables, batch_size, workers):
+    """
+    استعادة نسخة احتياطية (ZIP الجديد أو JSON القديم) من PATHS.
+    أكثر من ملف = نسخة كاملة ثم النسخ التزايدية المبنية عليها.
+    """
+    from services.backup_engine import restore, restore_chain
+
+    options = dict(mode=mode, table_names=set(tables) or None, batch_size=batch_size, workers=workers)
+    if len(paths) == 1:
+        counts, errors = restore(paths[0], **options)
+    else:
+        counts, errors = restore_chain(list(paths), **options)
+    for name, count in counts.items():
+        print(f"{name}: {count}")
+    print(f"تم استيراد {sum(counts.values())} سجل")
+    for error in errors[:20]:
+        print(f"خطأ: {error}")
+
+
+@app.cli.command("ledger-balances")
+@click.option('--rebuild', is_flag=True, help='إعادة بناء اللقطات الشهرية وأرصدة الحسابات من القيود المعتمدة')
+def ledger_balances_command(rebuild):
+    """التحقق من مطابقة أرصدة الحسابات ولقطاتها الشهرية للقيود (أو إعادة بنائها)"""
+    from services import ledger_balances
+
+    if rebuild:
+        print(f"تمت إعادة البناء: {ledger_balances.rebuild()} لقطة شهرية")
+        return
+
+    mismatches = ledger_balances.verify()
+    for account_id, period, expected, stored in mismatches['periods'][:50]:
+        print(f"حساب {account_id} شهر {period:%Y-%m}: المتوقع {expected} - المحفوظ {stored}")
+    for account_id, expected, stored in mismatches['balances'][:50]:
+        print(f"رصيد حساب {account_id}: المتوقع {expected} - المحفوظ {stored}")
+    if mismatches['periods'] or mismatches['balances']:
+        print(f"غير مطابق: {len(mismatches['periods'])} لقطة - {len(mismatches['balances'])} رصيد "
+              f"(flask ledger-balances --rebuild للإصلاح)")
+        raise SystemExit(1)
+    print("الأرصدة مطابقة للقيود")
+
+
+@app.cli.command("scheduler")
+@click.option('--run', 'job_name', default=None, help='تشغيل مهمة محددة الآن (مثل cleanup-locations)')
+@click.option('--limit', default=20, type=int, help='عدد التشغيلات المعروضة')
+def scheduler_command(job_name, limit):
+    """عرض المهام الخلفية وآخر تشغيلاتها (أو تشغيل مهمة الآن)"""
+    from services import scheduler
+
+    if job_name:
+        if job_name not in scheduler.job_names():
+            raise click.BadParameter(f"مهمة غير معروفة: {job_name}", param_hint='--run')
+        print(f"{job_name}: {scheduler.run(job_name)} سجل")
+        return
+
+    for item in scheduler.status()['jobs']:
+        last = item['last_run']
+        summary = f"{last['started_at']} {last['status']} {last['duration_ms']} ms - {last['rows_affected']} سجل" if last else "لم تُشغّل بعد"
+        print(f"{item['name']} {item['interval']}: {summary}")
+    print()
+    for run in scheduler.recent_runs(limit):
+        print(f"{run.started_at:%Y-%m-%d %H:%M:%S} {run.job_name} {run.status} {run.duration_ms} ms "
+              f"{run.rows_affected if run.rows_affected is not None else '-'} سجل ({run.worker})"
+              + (f" - {run.error}" if run.error else ''))
+
+
+@app.cli.command("importtime")
+@click.option('--top', default=25, show_default=True, help='عدد الوحدات المعروضة')
+@click.option('--budget', type=int, default=None, help='الحد الأقصى لزمن الاستيراد بالمللي ثانية (يفشل الأمر إذا تجاوزه)')
+def importtime_command(top, budget):
+    """قياس زمن استيراد التطبيق لكل وحدة وحزمة (python -X importtime في عملية جديدة)"""
+    from utils.lazy_imports import import_profile
+
+    profile = import_profile('app')
+    print(f"{'التراكمي ms':>12} {'الذاتي ms':>10}  الوحدة")
+    for name, self_ms, cumulative_ms in profile['modules'][:top]:
+        print(f"{cumulative_ms:12.1f} {self_ms:10.1f}  {name}")
+    print()
+    print("أثقل الحزم (الزمن الذاتي):")
+    for package, self_ms in sorted(profile['packages'].items(), key=lambda item: item[1], reverse=True)[:10]:
+        print(f"{self_ms:12.1f}  {package}")
+    print()
+    print(f"زمن استيراد التطبيق: {profile['total_ms']:.0f} ms - الذاكرة: {profile['max_rss_mb']:.0f} MB")
+    if profile['heavy']:
+        print(f"مكتبات ثقيلة تُستورد عند الإقلاع: {', '.join(profile['heavy'])}")
+    if budget is not None and profile['total_ms'] > budget:
+        raise click.ClickException(f"زمن الاستيراد {profile['total_ms']:.0f} ms يتجاوز الحد {budget} ms")
+
+
+@app.cli.command("preload-benchmark")
+@click.option('--workers', default=2, show_default=True, help='عدد العمال في كل وضع')
+def preload_benchmark_command(workers):
+    """قياس ذاكرة كل عامل بدون التحميل المسبق ومعه (RSS و PSS و USS بالميغابايت)"""
+    from services import preload
+
+    for result in preload.benchmark(workers):
+        mode = 'مع التحميل المسبق' if result['preload'] else 'بدون التحميل المسبق'
+        master = result['master']
+        print(f"{mode}: العملية الرئيسية RSS {master['rss']} MB")
+        for index, item in enumerate(result['workers'], 1):
+            print(f"  العامل {index}: RSS {item['rss']} - PSS {item['pss']} - USS {item['uss']} - مشترك {item['shared']}")
+        total = sum(item['pss'] for item in result['workers']) + master['pss']
+        print(f"  إجمالي PSS (الرئيسية + العمال): {total:.1f} MB")
+
+
+@app.cli.command("user-cache-benchmark")
+@click.option('--user-id', type=int, default=None, help='المستخدم المقاس (افتراضياً أول مستخدم غير مدير)')
+@click.option('--path', default='/dashboard/', show_default=True, help='الصفحة المطلوبة')
+@click.option('--requests', 'count', default=20, show_default=True, help='عدد الطلبات في كل وضع')
+def user_cache_benchmark_command(user_id, path, count):
+    """عدد الاستعلامات لكل طلب بدون ذاكرة المستخدمين والصلاحيات ومعها"""
+    from models import User, UserRole
+    from services import user_cache
+
+    if user_id is None:
+        user = (User.query.filter(User.role != UserRole.ADMIN).order_by(User.id).first()
+                or User.query.order_by(User.id).first())
+        if user is None:
+            print("لا يوجد مستخدمون للقياس")
+            return
+        user_id = user.id
+    db.session.remove()
+
+    for result in user_cache.benchmark(app, user_id, path, count):
+        mode = 'مع الذاكرة' if result['enabled'] else 'بدون الذاكرة'
+        print(f"{mode}: {result['queries']:.1f} استعلام/طلب "
+              f"(منها للمستخدم وصلاحياته {result['user_queries']:.1f}) - {result['ms']:.1f} ms/طلب")
+
+
+@app.cli.command("search-index")
+@click.option('--rebuild', is_flag=True, help='إعادة بناء الفهرس من الجداول')
+@click.option('--query', 'term', default=None, help='تجربة بحث وعرض النتائج ودرجاتها')
+@click.option('--entity', default='employee', show_default=True,
+              type=click.Choice(['employee', 'vehicle', 'document']))
+def search_index_command(rebuild, term, entity):
+    """حالة فهرس البحث (عدد الصفوف المفهرسة مقابل الجداول) وإعادة بنائه"""
+    import time
+    from services import search_index
+
+    if rebuild:
+        search_index.ensure_schema()
+        started = time.monotonic()
+        counts = search_index.rebuild()
+        print(f"أُعيد البناء في {time.monotonic() - started:.2f} ثانية: {counts}")
+
+    info = search_index.status()
+    print(f"الفهرس النصي: {info['backend']}")
+    for name, item in info['entities'].items():
+        flag = '' if item['rows'] == item['indexed'] else '  (غير مطابق - استخدم --rebuild)'
+        print(f"  {name}: {item['indexed']} مفهرس من {item['rows']}{flag}")
+
+    if term:
+        started = time.monotonic()
+        results = search_index.search(entity, term, limit=20)
+        print(f"'{term}' -> '{search_index.normalize(term)}': {len(results)} نتيجة "
+              f"في {(time.monotonic() - started) * 1000:.1f} ms")
+        for entity_id, score in results:
+            print(f"  {entity_id}: {score}")
+
+
+@app.cli.command("expiry-scan")
+@click.option('--dry-run', is_flag=True, help='عرض ما سيُنشأ دون كتابة تنبيهات أو إشعارات')
+@click.option('--source', 'sources', multiple=True,
+              type=click.Choice(['document', 'vehicle_registration', 'vehicle_inspection',
+                                 'vehicle_authorization', 'property_contract']),
+              help='مسح مصدر محدد فقط (يمكن تكراره)')
+def expiry_scan_command(dry_run, sources):
+    """مسح تواريخ الانتهاء وإنشاء التنبيهات الجديدة فقط، ثم عرض آخر مسح لكل مصدر"""
+    from services import expiry_scanner
+
+    for source, stats in expiry_scanner.scan(sources=sources or None, dry_run=dry_run).items():
+        print(f"{source}: {stats['matched']} عنصر في النطاق - {stats['alerts']} تنبيه جديد - "
+              f"{stats['notifications']} إشعار")
+    if dry_run:
+        return
+    print()
+    for source, item in expiry_scanner.watermarks().items():
+        print(f"{source}: {item['scanned_at']} النطاق {item['window_start']} .. {item['window_end']} "
+              f"({item['duration_ms']} ms)")
+
+
 
 # ================== صفحات المعلومات الثابتة ==================
 
@@ -718,81 +983,112 @@ def contact():
 
 # ================== نهاية صفحات المعلومات الثابتة ==================
 
+# المهام الخلفية: يشغّلها القائد فقط (services.scheduler) ويُسجل كل تشغيل في scheduler_job_runs
+import atexit
+from services import scheduler
+
 # وظيفة حذف البيانات القديمة (أقدم من 14 ساعة)
+@scheduler.job('cleanup-locations', run_soon=True, hours=6)
 def cleanup_old_location_data():
-    """حذف مواقع الموظفين الأقدم من 14 ساعة"""
-    with app.app_context():
-        from models import EmployeeLocation
-        from datetime import datetime, timedelta
-        
-        try:
-            cutoff_time = datetime.utcnow() - timedelta(hours=14)
-            old_locations = EmployeeLocation.query.filter(
-                EmployeeLocation.recorded_at < cutoff_time
-            ).delete()
-            
-            db.session.commit()
-            
-            if old_locations > 0:
-                logger.info(f"تم حذف {old_locations} موقع قديم")
-            
-            return old_locations
-        except Exception as e:
-            logger.error(f"خطأ في حذف البيانات القديمة: {str(e)}")
-            db.session.rollback()
-            return 0
+    """حذف مواقع الموظفين الأقدم من 14 ساعة على دفعات"""
+    from models import EmployeeLocation
+    from datetime import datetime, timedelta
+    
+    cutoff_time = datetime.utcnow() - timedelta(hours=14)
+    return scheduler.delete_in_batches(EmployeeLocation, EmployeeLocation.recorded_at < cutoff_time)
 
 # وظيفة حذف أحداث الدوائر الجغرافية القديمة (أقدم من 24 ساعة)
+@scheduler.job('cleanup-geofence-events', run_soon=True, hours=24)
 def cleanup_old_geofence_events():
-    """حذف جلسات وأحداث الدوائر الجغرافية الأقدم من 24 ساعة"""
-    with app.app_context():
-        from models import GeofenceEvent, GeofenceSession
-        from datetime import datetime, timedelta
-        from sqlalchemy import update
-        
-        try:
-            cutoff_time = datetime.utcnow() - timedelta(hours=24)
-            
-            # أولاً: فصل الـ FK constraints - تعيين entry_event_id و exit_event_id إلى NULL
-            db.session.execute(
-                update(GeofenceSession).where(
-                    GeofenceSession.entry_time < cutoff_time
-                ).values(entry_event_id=None, exit_event_id=None)
-            )
-            
-            # حذف جميع الـ sessions التي دخلت قبل 24 ساعة
-            old_sessions = db.session.query(GeofenceSession).filter(
-                GeofenceSession.entry_time < cutoff_time
-            ).delete()
-            
-            # حذف الأحداث القديمة
-            old_events = db.session.query(GeofenceEvent).filter(
-                GeofenceEvent.recorded_at < cutoff_time
-            ).delete()
-            
-            db.session.commit()
-            
-            if old_events > 0 or old_sessions > 0:
-                logger.info(f"✅ حذف {old_sessions} جلسة و {old_events} حدث دائرة جغرافية قديمة (> 24 ساعة)")
-            
-            return old_events + old_sessions
-        except Exception as e:
-            logger.error(f"خطأ في حذف أحداث الدوائر الجغرافية: {str(e)}")
-            db.session.rollback()
-            return 0
-
-# تشغيل تنظيف البيانات عند بدء التطبيق وكل 6 ساعات
-import atexit
-from apscheduler.schedulers.background import BackgroundScheduler
+    """حذف جلسات وأحداث الدوائر الجغرافية الأقدم من 24 ساعة على دفعات"""
+    from models import GeofenceEvent, GeofenceSession
+    from datetime import datetime, timedelta
+    from sqlalchemy import update
+    
+    cutoff_time = datetime.utcnow() - timedelta(hours=24)
+    
+    # حذف جميع الـ sessions التي دخلت قبل 24 ساعة
+    old_sessions = scheduler.delete_in_batches(GeofenceSession, GeofenceSession.entry_time < cutoff_time)
+    
+    # فصل أي جلسة متبقية تشير إلى أحداث الدفعة قبل حذفها (FK)
+    def detach_sessions(event_ids):
+        db.session.execute(
+            update(GeofenceSession).where(GeofenceSession.entry_event_id.in_(event_ids))
+            .values(entry_event_id=None)
+        )
+        db.session.execute(
+            update(GeofenceSession).where(GeofenceSession.exit_event_id.in_(event_ids))
+            .values(exit_event_id=None)
+        )
+    
+    # حذف الأحداث القديمة
+    old_events = scheduler.delete_in_batches(GeofenceEvent, GeofenceEvent.recorded_at < cutoff_time,
+                                             before_delete=detach_sessions)
+    
+    if old_events > 0 or old_sessions > 0:
+        logger.info(f"✅ حذف {old_sessions} جلسة و {old_events} حدث دائرة جغرافية قديمة (> 24 ساعة)")
+    
+    return old_events + old_sessions
 
-scheduler = BackgroundScheduler()
-scheduler.add_job(func=cleanup_old_location_data, trigger="interval", hours=6)
-scheduler.add_job(func=cleanup_old_geofence_events, trigger="interval", hours=24)
-scheduler.start()
+# إعادة محاولة الإيميلات المؤجلة في قائمة الإرسال
+@scheduler.job('email-queue', minutes=1)
+def deliver_queued_emails():
+    """إرسال الإيميلات المستحقة (الجديدة تُرسل فوراً، وهذه للمحاولات المؤجلة)"""
+    from services.email_queue import deliver_due
+    
+    stats = deliver_due()
+    return sum(stats.values()) if stats else 0
+
+# إعادة محاولة الملفات المؤجلة في قائمة مزامنة Google Drive
+@scheduler.job('drive-sync', minutes=1)
+def sync_drive_uploads():
+    """رفع الملفات المستحقة إلى Google Drive (الجديدة تُرفع فوراً، وهذه للمحاولات المؤجلة)"""
+    from services.drive_sync import sync_due
+    
+    stats = sync_due()
+    return sum(stats.values()) if stats else 0
+
+# تنبيهات انتهاء الوثائق والمركبات وعقود السكن (كل تنبيه مرة واحدة لكل عتبة)
+@scheduler.job('expiry-scan', run_soon=True, hours=6)
+def scan_expiring_documents():
+    """مسح تواريخ الانتهاء وإنشاء إشعارات التنبيهات الجديدة دفعة واحدة"""
+    from services import expiry_scanner
+    
+    return sum(stats['notifications'] for stats in expiry_scanner.scan().values())
+
+# إسقاط مجلدات وملفات Drive التي تغيرت من ذاكرة Drive
+@scheduler.job('drive-cache', minutes=5)
+def refresh_drive_cache():
+    """قراءة سجل التغييرات في Drive منذ آخر تشغيل"""
+    from services import drive_cache
+    from services.drive_sync import configured_client
+    
+    client = configured_client()
+    if client is not None:
+        return drive_cache.sync_changes(client)
+    return 0
+
+# إنشاء فهرس البحث النصي (FTS5 / pg_trgm) وبناؤه أول مرة (لا شيء إذا كان موجوداً)
+@scheduler.job('search-index-setup', run_soon=True, hours=24)
+def setup_search_index():
+    """تجهيز الفهرس النصي للبحث وبناء search_index إذا كان فارغاً"""
+    from services import search_index
+    
+    search_index.ensure_schema()
+
+# البناء الأول لأرصدة الحسابات الشهرية بعد الترقية (لا شيء إذا كان الجدول مبنياً)
+@scheduler.job('ledger-backfill', run_soon=True, hours=24)
+def backfill_ledger_balances():
+    """بناء account_period_balances من القيود المعتمدة إذا كان فارغاً"""
+    from services import ledger_balances
+    
+    return ledger_balances.ensure_backfill()
 
-# تشغيل التنظيف عند بدء التطبيق
-cleanup_old_location_data()
-cleanup_old_geofence_events()
+# انتخاب القائد في الخلفية؛ الإقلاع لا ينتظر أي مهمة
+# مع التحميل المسبق يبدأ في كل عامل بعد fork (services.preload.after_fork) لا في العملية الرئيسية
+from services import preload
+if not preload.ENABLED:
+    scheduler.start(app)
 
-# إيقاف المجدول عند إيقاف التطبيق
-atexit.register(lambda: scheduler.shutdown())
+# إيقاف المجدول وتحرير القيادة عند إيقاف التطبيق
+atexit.register(scheduler.shutdown)
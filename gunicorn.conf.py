@@ -0,0 +1,39 @@
+"""
+إعدادات gunicorn (يقرؤها gunicorn تلقائياً من مجلد التشغيل؛ خيارات سطر الأوامر تتقدم عليها)
+
+التحميل المسبق: PRELOAD_APP=1 (أو --preload) يستورد التطبيق مرة واحدة في العملية الرئيسية
+ثم يُنشئ العمال بـ fork فيتشاركون صفحات الذاكرة المقروءة فقط. التفاصيل في services/preload.py
+والقياس بـ flask preload-benchmark.
+
+    PRELOAD_APP=1 gunicorn --bind 0.0.0.0:5000 --workers 2 main:app
+"""
+import os
+import sys
+
+preload_app = (os.environ.get('PRELOAD_APP', '').lower() in ('1', 'true', 'yes')
+               or '--preload' in sys.argv)
+if preload_app:
+    # يقرؤه app.py عند الاستيراد فيؤجل المجدول إلى ما بعد fork
+    os.environ['PRELOAD_APP'] = '1'
+
+
+def when_ready(server):
+    """العملية الرئيسية جاهزة: بناء الحالة المشتركة قبل إنشاء العمال"""
+    if server.cfg.preload_app:
+        from app import app
+        from services import preload
+        preload.warm(app)
+
+
+def pre_fork(server, worker):
+    if server.cfg.preload_app:
+        from app import app
+        from services import preload
+        preload.before_fork(app)
+
+
+def post_fork(server, worker):
+    if server.cfg.preload_app:
+        from app import app
+        from services import preload
+        preload.after_fork(app)
@@ -0,0 +1,39 @@
+"""Add updated_at indexes for incremental backups
+
+النسخ التزايدية تقرأ من كل جدول ما عُدّل بعد آخر نقطة (updated_at >= ...)؛
+بدون فهرس يصبح كل استعلام مسحاً كاملاً للجدول.
+
+Revision ID: b7d41e9a2c53
+Revises: c684569a7d3c
+Create Date: 2026-10-19 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7d41e9a2c53'
+down_revision = 'c684569a7d3c'
+branch_labels = None
+depends_on = None
+
+
+TABLES = [
+    'employee', 'vehicle', 'department', 'salary', 'attendance', 'mobile_devices',
+    'vehicle_workshop', 'document', 'vehicle_accident', 'employee_requests',
+    'rental_properties', 'property_payments', 'property_furnishings', 'geofences',
+    'geofence_sessions', 'sim_cards', 'voicehub_calls', 'vehicle_external_safety_check',
+]
+
+
+def upgrade():
+    """Index updated_at on every table included in backups"""
+    for table in TABLES:
+        op.execute(f'CREATE INDEX IF NOT EXISTS ix_{table}_updated_at ON "{table}" (updated_at)')
+
+
+def downgrade():
+    """Drop the updated_at indexes"""
+    for table in TABLES:
+        op.execute(f'DROP INDEX IF EXISTS ix_{table}_updated_at')
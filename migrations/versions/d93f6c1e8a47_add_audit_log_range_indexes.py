@@ -0,0 +1,39 @@
+"""Add range indexes to the append-only audit tables
+
+سجلات المراجعة تُضاف فقط وتُقرأ بالكيان أو المستخدم خلال فترة زمنية. في PostgreSQL
+فهرس BRIN على الوقت صغير جداً لأن ترتيب الإضافة يطابق ترتيب الوقت.
+
+Revision ID: d93f6c1e8a47
+Revises: b7d41e9a2c53
+Create Date: 2026-10-19 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd93f6c1e8a47'
+down_revision = 'b7d41e9a2c53'
+branch_labels = None
+depends_on = None
+
+
+TABLES = ['audit_log', 'system_audit']
+
+
+def upgrade():
+    """Index audit tables by entity/user and time"""
+    postgres = op.get_bind().dialect.name == 'postgresql'
+    for table in TABLES:
+        op.execute(f'CREATE INDEX IF NOT EXISTS ix_{table}_entity_time ON {table} (entity_type, entity_id, timestamp)')
+        op.execute(f'CREATE INDEX IF NOT EXISTS ix_{table}_user_time ON {table} (user_id, timestamp)')
+        using = 'USING brin ' if postgres else ''
+        op.execute(f'CREATE INDEX IF NOT EXISTS ix_{table}_timestamp ON {table} {using}(timestamp)')
+
+
+def downgrade():
+    """Drop the audit range indexes"""
+    for table in TABLES:
+        for suffix in ('entity_time', 'user_time', 'timestamp'):
+            op.execute(f'DROP INDEX IF EXISTS ix_{table}_{suffix}')
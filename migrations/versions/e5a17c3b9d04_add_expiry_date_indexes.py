@@ -0,0 +1,40 @@
+"""Add expiry date indexes for the expiry scanner
+
+ماسح انتهاء الصلاحيات (services/expiry_scanner) يقرأ من كل مصدر نطاق تواريخ الانتهاء
+القريبة فقط؛ بدون فهرس يصبح كل مسح قراءة كاملة لجدول المركبات والعقارات.
+(document.expiry_date مفهرس مسبقاً: idx_document_expiry)
+
+Revision ID: e5a17c3b9d04
+Revises: d93f6c1e8a47
+Create Date: 2026-10-19 14:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e5a17c3b9d04'
+down_revision = 'd93f6c1e8a47'
+branch_labels = None
+depends_on = None
+
+
+INDEXES = [
+    ('ix_vehicle_registration_expiry', 'vehicle', 'registration_expiry_date'),
+    ('ix_vehicle_inspection_expiry', 'vehicle', 'inspection_expiry_date'),
+    ('ix_vehicle_authorization_expiry', 'vehicle', 'authorization_expiry_date'),
+    ('ix_rental_properties_contract_end', 'rental_properties', 'contract_end_date'),
+]
+
+
+def upgrade():
+    """Index the expiry date columns scanned by range"""
+    for name, table, column in INDEXES:
+        op.execute(f'CREATE INDEX IF NOT EXISTS {name} ON {table} ({column})')
+
+
+def downgrade():
+    """Drop the expiry date indexes"""
+    for name, _, _ in INDEXES:
+        op.execute(f'DROP INDEX IF EXISTS {name}')
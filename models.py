@@ -449,10 +449,11 @@ class User(UserMixin, db.Model):
         if self.role == UserRole.ADMIN:
             return True
             
-        # التحقق من صلاحيات القسم المحدد
-        for user_permission in self.permissions:
-            if user_permission.module == module:
-                return user_permission.permissions & permission
+        # التحقق من صلاحيات القسم المحدد (من ذاكرة المستخدمين)
+        from services import user_cache
+        bits = user_cache.permissions(self).get(module)
+        if bits is not None:
+            return bits & permission
                 
         return False
 
@@ -477,7 +478,8 @@ class User(UserMixin, db.Model):
         if self.role == UserRole.ADMIN:
             return True
             
-        return any(p.module == module for p in self.permissions)
+        from services import user_cache
+        return module in user_cache.permissions(self)
     
     def can_access_department(self, department_id):
         """التحقق مما إذا كان المستخدم يمكنه الوصول إلى قسم معين"""
@@ -608,6 +610,12 @@ class FeesCost(db.Model):
 
 class SystemAudit(db.Model):
     """سجل عمليات النظام للإجراءات المهمة - Audit trail"""
+    # جدول إضافة فقط: فهارس للبحث بالكيان والمستخدم خلال فترة، وBRIN للوقت في PostgreSQL
+    __table_args__ = (
+        db.Index('ix_system_audit_entity_time', 'entity_type', 'entity_id', 'timestamp'),
+        db.Index('ix_system_audit_user_time', 'user_id', 'timestamp'),
+        db.Index('ix_system_audit_timestamp', 'timestamp', postgresql_using='brin'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     action = db.Column(db.String(100), nullable=False)  # نوع الإجراء (إضافة، تعديل، حذف)
     entity_type = db.Column(db.String(50), nullable=False)  # نوع الكيان (موظف، قسم، راتب، الخ)
@@ -657,10 +665,12 @@ class SystemAudit(db.Model):
             timestamp=datetime.utcnow()
         )
         
-        # حفظ السجل في قاعدة البيانات
-        from app import db
-        db.session.add(audit)
-        db.session.commit()
+        # يُكتب مع سجلات الطلب دفعة واحدة بعد انتهائه بدل حفظ معاملة المستدعي
+        from services import audit_writer
+        audit_writer.record('system_audit', {
+            column.name: getattr(audit, column.name)
+            for column in cls.__table__.columns if column.name != 'id'
+        })
         
         return audit
 
@@ -708,6 +718,13 @@ class Vehicle(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
+    # فهارس نطاقات تواريخ الانتهاء (services/expiry_scanner)
+    __table_args__ = (
+        db.Index('ix_vehicle_registration_expiry', 'registration_expiry_date'),
+        db.Index('ix_vehicle_inspection_expiry', 'inspection_expiry_date'),
+        db.Index('ix_vehicle_authorization_expiry', 'authorization_expiry_date'),
+    )
+    
     # العلاقات
     rental_records = db.relationship('VehicleRental', back_populates='vehicle', cascade='all, delete-orphan')
     workshop_records = db.relationship('VehicleWorkshop', back_populates='vehicle', cascade='all, delete-orphan')
@@ -1541,6 +1558,12 @@ class ExternalAuthorization(db.Model):
 class AuditLog(db.Model):
     """نموذج سجل المراجعة لتتبع نشاط المستخدمين"""
     __tablename__ = 'audit_log'
+    # جدول إضافة فقط: فهارس للبحث بالكيان والمستخدم خلال فترة، وBRIN للوقت في PostgreSQL
+    __table_args__ = (
+        db.Index('ix_audit_log_entity_time', 'entity_type', 'entity_id', 'timestamp'),
+        db.Index('ix_audit_log_user_time', 'user_id', 'timestamp'),
+        db.Index('ix_audit_log_timestamp', 'timestamp', postgresql_using='brin'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
@@ -2136,6 +2159,10 @@ class RentalProperty(db.Model):
     # علاقة الموظفين القاطنين
     residents = db.relationship('Employee', secondary=property_employees, backref='housing_properties')
     
+    __table_args__ = (
+        db.Index('ix_rental_properties_contract_end', 'contract_end_date'),
+    )
+    
     @property
     def remaining_days(self):
         """حساب الأيام المتبقية للعقد"""
@@ -2962,3 +2989,301 @@ class Notification(db.Model):
     def __repr__(self):
         return f'<Notification #{self.id} - {self.notification_type} - User {self.user_id}>'
 
+
+
+class FileBlob(db.Model):
+    """ملف مخزن حسب بصمة محتواه مع عداد المراجع (انظر services/blob_store.py)"""
+    __tablename__ = 'file_blobs'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    sha256 = db.Column(db.String(64), nullable=False)
+    extension = db.Column(db.String(16), nullable=False, default='bin')
+    size = db.Column(db.BigInteger, nullable=False, default=0)
+    ref_count = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    last_referenced_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        db.UniqueConstraint('sha256', 'extension', name='uq_file_blob_digest'),
+    )
+    
+    def __repr__(self):
+        return f'<FileBlob {self.sha256[:12]}.{self.extension} refs={self.ref_count}>'
+
+
+class QueuedEmail(db.Model):
+    """إيميل صادر في قائمة الإرسال (انظر services/email_queue.py)"""
+    __tablename__ = 'email_queue'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    message_id = db.Column(db.String(64), nullable=False, unique=True)
+    
+    to_email = db.Column(db.String(255), nullable=False)
+    to_name = db.Column(db.String(255))
+    from_email = db.Column(db.String(255), nullable=False)
+    from_name = db.Column(db.String(255))
+    subject = db.Column(db.String(500), nullable=False)
+    html_content = db.Column(db.Text)
+    text_content = db.Column(db.Text)
+    
+    # queued, sending, sent, failed
+    status = db.Column(db.String(20), nullable=False, default='queued')
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=8)
+    next_attempt_at = db.Column(db.DateTime, default=datetime.utcnow)
+    locked_until = db.Column(db.DateTime)
+    last_error = db.Column(db.Text)
+    transport = db.Column(db.String(20))
+    
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    sent_at = db.Column(db.DateTime)
+    
+    attachments = db.relationship('QueuedEmailAttachment', backref='email', lazy='selectin',
+                                  cascade='all, delete-orphan', order_by='QueuedEmailAttachment.id')
+    
+    __table_args__ = (
+        db.Index('idx_email_queue_due', 'status', 'next_attempt_at'),
+        db.Index('idx_email_queue_status_created', 'status', 'created_at'),
+    )
+    
+    def __repr__(self):
+        return f'<QueuedEmail {self.message_id} {self.status} -> {self.to_email}>'
+
+
+class QueuedEmailAttachment(db.Model):
+    """مرفق إيميل محفوظ كمرجع في مخزن الملفات بدلاً من نسخه داخل السجل"""
+    __tablename__ = 'email_queue_attachments'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    email_id = db.Column(db.Integer, db.ForeignKey('email_queue.id', ondelete='CASCADE'), nullable=False, index=True)
+    filename = db.Column(db.String(255), nullable=False)
+    content_type = db.Column(db.String(120), default='application/octet-stream')
+    size = db.Column(db.BigInteger, default=0)
+    file_path = db.Column(db.String(500), nullable=False)
+    
+    def __repr__(self):
+        return f'<QueuedEmailAttachment {self.filename}>'
+
+
+class DriveSyncJob(db.Model):
+    """ملف محفوظ محلياً بانتظار رفعه إلى Google Drive (انظر services/drive_sync.py)"""
+    __tablename__ = 'drive_sync_jobs'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    
+    # الملف المحلي (نسبة لجذر المشروع) ومكانه في Drive: أسماء المجلدات من المجلد الرئيسي
+    local_path = db.Column(db.String(512), nullable=False)
+    file_name = db.Column(db.String(255), nullable=False)
+    mime_type = db.Column(db.String(100), default='application/octet-stream')
+    file_size = db.Column(db.BigInteger, default=0)
+    folder_path = db.Column(db.Text, nullable=False)  # JSON
+    delete_after = db.Column(db.Boolean, default=False)  # ملف مؤقت يُحذف بعد الرفع
+    
+    # السجل الذي تُكتب فيه روابط Drive بعد الرفع
+    target_type = db.Column(db.String(50), nullable=False)
+    target_id = db.Column(db.Integer, nullable=False)
+    role = db.Column(db.String(20))  # pdf, image, video...
+    employee_request_id = db.Column(db.Integer, db.ForeignKey('employee_requests.id', ondelete='CASCADE'), index=True)
+    
+    # pending, uploading, done, failed
+    status = db.Column(db.String(20), nullable=False, default='pending')
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=10)
+    next_attempt_at = db.Column(db.DateTime, default=datetime.utcnow)
+    locked_until = db.Column(db.DateTime)
+    last_error = db.Column(db.Text)
+    
+    # جلسة الرفع القابل للاستئناف
+    upload_uri = db.Column(db.Text)
+    bytes_uploaded = db.Column(db.BigInteger, nullable=False, default=0)
+    
+    drive_folder_id = db.Column(db.String(255))
+    drive_file_id = db.Column(db.String(255))
+    drive_view_url = db.Column(db.Text)
+    drive_download_url = db.Column(db.Text)
+    
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    completed_at = db.Column(db.DateTime)
+    
+    __table_args__ = (
+        db.Index('idx_drive_sync_due', 'status', 'next_attempt_at'),
+        db.Index('idx_drive_sync_target', 'target_type', 'target_id'),
+    )
+    
+    def __repr__(self):
+        return f'<DriveSyncJob #{self.id} {self.status} {self.target_type}:{self.target_id}>'
+
+
+class DriveFolderCache(db.Model):
+    """خريطة (المجلد الأب، الاسم) -> معرف المجلد في Google Drive (انظر services/drive_cache.py)"""
+    __tablename__ = 'drive_folder_cache'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    drive_id = db.Column(db.String(255), nullable=False)
+    parent_id = db.Column(db.String(255), nullable=False)
+    name = db.Column(db.String(500), nullable=False)
+    folder_id = db.Column(db.String(255), nullable=False, index=True)
+    cached_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    
+    __table_args__ = (
+        db.UniqueConstraint('drive_id', 'parent_id', 'name', name='uq_drive_folder_cache_path'),
+    )
+    
+    def __repr__(self):
+        return f'<DriveFolderCache {self.name} -> {self.folder_id}>'
+
+
+class DriveFileCache(db.Model):
+    """بيانات ملف أو مجلد في Google Drive محفوظة لتجنب طلبها من الواجهة في كل عرض"""
+    __tablename__ = 'drive_file_cache'
+    
+    file_id = db.Column(db.String(255), primary_key=True)
+    drive_id = db.Column(db.String(255), nullable=False)
+    parent_id = db.Column(db.String(255), index=True)
+    name = db.Column(db.String(500))
+    mime_type = db.Column(db.String(255))
+    size = db.Column(db.BigInteger)
+    web_view_link = db.Column(db.Text)
+    web_content_link = db.Column(db.Text)
+    modified_time = db.Column(db.String(40))
+    cached_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<DriveFileCache {self.name} ({self.file_id})>'
+
+
+class DriveCacheState(db.Model):
+    """حالة ذاكرة Drive: رمز صفحة التغييرات لكل Drive ووقت آخر جلب كامل لكل مجلد"""
+    __tablename__ = 'drive_cache_state'
+    
+    key = db.Column(db.String(300), primary_key=True)
+    value = db.Column(db.Text)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<DriveCacheState {self.key}>'
+
+
+class BackupRun(db.Model):
+    """نسخة احتياطية متتبعة (كاملة أو تزايدية)؛ parent_id يربط كل نسخة تزايدية بالتي قبلها"""
+    __tablename__ = 'backup_runs'
+    
+    id = db.Column(db.String(32), primary_key=True)
+    kind = db.Column(db.String(20), nullable=False)  # full / incremental
+    parent_id = db.Column(db.String(32), db.ForeignKey('backup_runs.id', ondelete='SET NULL'), nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+    created_by = db.Column(db.String(100))
+    snapshot_at = db.Column(db.DateTime, nullable=False)
+    table_count = db.Column(db.Integer, default=0)
+    row_count = db.Column(db.BigInteger, default=0)
+    tombstone_count = db.Column(db.Integer, default=0)
+    size_bytes = db.Column(db.BigInteger)
+    duration_ms = db.Column(db.Integer)
+    
+    def __repr__(self):
+        return f'<BackupRun {self.kind} {self.id}>'
+
+
+class BackupWatermark(db.Model):
+    """آخر نقطة نسخ لكل جدول: النسخة التزايدية التالية تصدّر ما تغيّر بعدها فقط"""
+    __tablename__ = 'backup_watermarks'
+    
+    table_name = db.Column(db.String(64), primary_key=True)
+    high_water = db.Column(db.DateTime, nullable=False)
+    backup_id = db.Column(db.String(32), db.ForeignKey('backup_runs.id', ondelete='SET NULL'), nullable=True)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<BackupWatermark {self.table_name} {self.high_water}>'
+
+
+class BackupTombstone(db.Model):
+    """سجل محذوف من جدول ضمن النسخ الاحتياطي، لتطبيق الحذف عند استعادة النسخ التزايدية"""
+    __tablename__ = 'backup_tombstones'
+    __table_args__ = (
+        db.Index('ix_backup_tombstones_table_deleted', 'table_name', 'deleted_at'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    table_name = db.Column(db.String(64), nullable=False)
+    row_key = db.Column(db.Text, nullable=False)  # JSON بقيم المفتاح الأساسي
+    deleted_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<BackupTombstone {self.table_name} {self.row_key}>'
+
+
+class SchedulerJobRun(db.Model):
+    """تشغيل مهمة خلفية من المجدول: المدة وعدد السجلات المتأثرة والنتيجة"""
+    __tablename__ = 'scheduler_job_runs'
+    __table_args__ = (
+        db.Index('ix_scheduler_job_runs_job_started', 'job_name', 'started_at'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    job_name = db.Column(db.String(100), nullable=False)
+    started_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+    finished_at = db.Column(db.DateTime)
+    duration_ms = db.Column(db.Integer)
+    rows_affected = db.Column(db.Integer)
+    status = db.Column(db.String(20), nullable=False)  # success / error
+    error = db.Column(db.Text)
+    worker = db.Column(db.String(100))  # اسم الجهاز ورقم العملية
+    
+    def __repr__(self):
+        return f'<SchedulerJobRun {self.job_name} {self.status}>'
+
+
+class SearchEntry(db.Model):
+    """مدخل فهرس البحث (services/search_index): نص موحد الإملاء لموظف أو مركبة أو وثيقة"""
+    __tablename__ = 'search_index'
+    __table_args__ = (
+        db.UniqueConstraint('entity', 'entity_id', name='uq_search_index_entity'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    entity = db.Column(db.String(20), nullable=False)  # employee / vehicle / document
+    entity_id = db.Column(db.Integer, nullable=False)
+    keys = db.Column(db.Text, nullable=False, default='')  # المعرفات بدون مسافات (الرقم الوظيفي، اللوحة ...)
+    content = db.Column(db.Text, nullable=False, default='')  # كل النص القابل للبحث بعد التوحيد
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<SearchEntry {self.entity} {self.entity_id}>'
+
+
+class ExpiryAlert(db.Model):
+    """تنبيه انتهاء صلاحية أُرسل (services/expiry_scanner): مرة واحدة لكل عنصر وتاريخ انتهاء وعتبة"""
+    __tablename__ = 'expiry_alerts'
+    __table_args__ = (
+        db.UniqueConstraint('entity', 'entity_id', 'expiry_date', 'threshold', name='uq_expiry_alert'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    entity = db.Column(db.String(30), nullable=False)  # document / vehicle_registration / property_contract ...
+    entity_id = db.Column(db.Integer, nullable=False)
+    expiry_date = db.Column(db.Date, nullable=False)
+    threshold = db.Column(db.Integer, nullable=False)  # عدد الأيام (0 = منتهية)
+    recipients = db.Column(db.Integer, nullable=False, default=0)  # عدد الإشعارات المنشأة
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+    
+    def __repr__(self):
+        return f'<ExpiryAlert {self.entity} {self.entity_id} {self.threshold}>'
+
+
+class ExpiryScanWatermark(db.Model):
+    """آخر مسح لكل مصدر في services/expiry_scanner: النطاق المفحوص وما وُجد وما أُرسل"""
+    __tablename__ = 'expiry_scan_watermarks'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    source = db.Column(db.String(30), nullable=False, unique=True)
+    scanned_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    window_start = db.Column(db.Date, nullable=False)  # أقدم تاريخ انتهاء مفحوص
+    window_end = db.Column(db.Date, nullable=False)  # أبعد تاريخ انتهاء مفحوص
+    matched = db.Column(db.Integer, nullable=False, default=0)  # العناصر داخل النطاق
+    alerts = db.Column(db.Integer, nullable=False, default=0)  # التنبيهات الجديدة
+    notifications = db.Column(db.Integer, nullable=False, default=0)
+    duration_ms = db.Column(db.Integer)
+    
+    def __repr__(self):
+        return f'<ExpiryScanWatermark {self.source} {self.window_end}>'
@@ -240,6 +240,21 @@ class TransactionEntry(db.Model):
     cost_center = db.relationship('CostCenter', backref='transaction_entries')
 
 
+class AccountPeriodBalance(db.Model):
+    """مجاميع المدين والدائن الشهرية لكل حساب من القيود المعتمدة (تُحدّث عند حفظ القيود)"""
+    __tablename__ = 'account_period_balances'
+    
+    account_id = db.Column(db.Integer, db.ForeignKey('accounts.id', ondelete='CASCADE'), primary_key=True)
+    period = db.Column(db.Date, primary_key=True)  # أول يوم في الشهر
+    debit = db.Column(db.Numeric(15, 2), nullable=False, default=0)
+    credit = db.Column(db.Numeric(15, 2), nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    __table_args__ = (
+        db.Index('idx_account_period_balances_period', 'period'),
+    )
+
+
 class Budget(db.Model):
     """الموازنات"""
     __tablename__ = 'budgets'
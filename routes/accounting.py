@@ -14,6 +14,7 @@ from models import UserRole, Module, Permission
 from models_accounting import *
 from forms.accounting import *
 from utils.helpers import log_activity
+from services import ledger_balances
 from utils.chart_of_accounts import create_default_chart_of_accounts, get_accounts_tree, get_account_hierarchy, calculate_account_balance
 
 # إنشاء البلوبرينت
@@ -59,16 +60,19 @@ def dashboard():
             Account.is_active == True
         ).scalar() or 0
         
-        # صافي الأرباح هذا الشهر
-        monthly_revenue = db.session.query(func.sum(Account.balance)).filter(
-            Account.account_type == AccountType.REVENUE,
+        # صافي الأرباح هذا الشهر (من لقطة الشهر الحالي)
+        month_totals = ledger_balances.period_totals(current_month_start, current_month_end)
+        monthly_revenue = Decimal('0')
+        monthly_expenses = Decimal('0')
+        for account in Account.query.filter(
+            Account.account_type.in_([AccountType.REVENUE, AccountType.EXPENSES]),
             Account.is_active == True
-        ).scalar() or 0
-        
-        monthly_expenses = db.session.query(func.sum(Account.balance)).filter(
-            Account.account_type == AccountType.EXPENSES,
-            Account.is_active == True
-        ).scalar() or 0
+        ).all():
+            balance = ledger_balances.natural_balance(account.account_type, *month_totals.get(account.id, (None, None)))
+            if account.account_type == AccountType.REVENUE:
+                monthly_revenue += balance
+            else:
+                monthly_expenses += balance
         
         net_profit = monthly_revenue - monthly_expenses
         
@@ -395,33 +399,7 @@ def view_account(account_id):
         .limit(20).all()
     
     # الرصيد الشهري للسنة الحالية
-    current_year = datetime.now().year
-    monthly_balances = []
-    
-    for month in range(1, 13):
-        month_start = date(current_year, month, 1)
-        if month == 12:
-            month_end = date(current_year + 1, 1, 1) - timedelta(days=1)
-        else:
-            month_end = date(current_year, month + 1, 1) - timedelta(days=1)
-        
-        # حساب الرصيد حتى نهاية الشهر
-        debits = db.session.query(func.sum(TransactionEntry.amount)).join(Transaction).filter(
-            TransactionEntry.account_id == account.id,
-            TransactionEntry.entry_type == EntryType.DEBIT,
-            Transaction.transaction_date <= month_end,
-            Transaction.is_approved == True
-        ).scalar() or 0
-        
-        credits = db.session.query(func.sum(TransactionEntry.amount)).join(Transaction).filter(
-            TransactionEntry.account_id == account.id,
-            TransactionEntry.entry_type == EntryType.CREDIT,
-            Transaction.transaction_date <= month_end,
-            Transaction.is_approved == True
-        ).scalar() or 0
-        
-        balance = debits - credits if account.account_type in [AccountType.ASSETS, AccountType.EXPENSES] else credits - debits
-        monthly_balances.append(balance)
+    monthly_balances = ledger_balances.monthly_balances(account, datetime.now().year)
     
     return render_template('accounting/accounts/view.html',
                          account=account,
@@ -874,18 +852,6 @@ def create_journal_entry():
             flash('لا يمكن اعتماد القيد غير المتوازن', 'danger')
             return redirect(request.url)
         
-        # تحديث أرصدة الحسابات إذا كان القيد معتمداً
-        if transaction.is_approved:
-            for i in range(len(account_ids)):
-                if account_ids[i] and account_ids[i] != '':
-                    debit_amount = float(debits[i]) if debits[i] else 0
-                    credit_amount = float(credits[i]) if credits[i] else 0
-                    
-                    if debit_amount > 0 or credit_amount > 0:
-                        account = Account.query.get(int(account_ids[i]))
-                        if account:
-                            account.balance += (debit_amount - credit_amount)
-        
         # إضافة المبلغ الإجمالي للمعاملة
         # transaction.amount = max(total_debit, total_credit)  # مؤقت حتى يتم إضافة الحقل
         
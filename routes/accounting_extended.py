@@ -3,20 +3,19 @@
 """
 from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, make_response, send_file
 from flask_login import login_required, current_user
-from sqlalchemy import func, and_, or_, extract, desc, asc, text
+from sqlalchemy import extract, desc, asc, text
 from sqlalchemy.orm import joinedload
 from datetime import datetime, date, timedelta
 from decimal import Decimal
 import json
 import io
-from openpyxl import Workbook
-from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
 
 from app import db
 from models import UserRole, Employee, Vehicle, Department, Module, Permission
 from models_accounting import *
 from forms.accounting import *
 from utils.helpers import log_activity
+from services import journal_posting, ledger_balances
 
 # إنشاء البلوبرينت الثاني
 accounting_ext_bp = Blueprint('accounting_ext', __name__, url_prefix='/accounting')
@@ -101,20 +100,6 @@ def quick_entry():
             )
             db.session.add(credit_entry)
             
-            # تحديث أرصدة الحسابات
-            debit_account = Account.query.get(form.debit_account_id.data)
-            credit_account = Account.query.get(form.credit_account_id.data)
-            
-            if debit_account.account_type in [AccountType.ASSETS, AccountType.EXPENSES]:
-                debit_account.balance += form.amount.data
-            else:
-                debit_account.balance -= form.amount.data
-            
-            if credit_account.account_type in [AccountType.ASSETS, AccountType.EXPENSES]:
-                credit_account.balance -= form.amount.data
-            else:
-                credit_account.balance += form.amount.data
-            
             # تحديث رقم القيد التالي
             settings.next_transaction_number += 1
             
@@ -194,19 +179,11 @@ def salary_processing():
                 flash(f'الحسابات المحاسبية المفقودة: {", ".join(missing_accounts)}', 'danger')
                 return render_template('accounting/salary_processing.html', form=form)
             
-            # إعدادات النظام
-            settings = AccountingSettings.query.first()
-            if not settings:
-                settings = AccountingSettings(company_name='شركة نُظم', next_transaction_number=1)
-                db.session.add(settings)
-                db.session.flush()
-            
-            fiscal_year = FiscalYear.query.filter_by(is_active=True).first()
-            
             total_salaries = Decimal('0')
-            processed_count = 0
+            salary_date = date(form.year.data, int(form.month.data), 1)
+            entries = []
             
-            # معالجة كل موظف
+            # قيد لكل موظف: مدين مصروف رواتب، دائن النقدية
             for employee in employees:
                 if not employee.salary:
                     continue
@@ -220,53 +197,21 @@ def salary_processing():
                 if net_salary <= 0:
                     continue
                 
-                # إنشاء قيد الراتب
-                transaction_number = f"{settings.transaction_prefix}{settings.next_transaction_number:06d}"
-                
-                transaction = Transaction(
-                    transaction_number=transaction_number,
-                    transaction_date=date(form.year.data, int(form.month.data), 1),
-                    transaction_type=TransactionType.SALARY,
-                    description=f"راتب شهر {form.month.data}/{form.year.data} - {employee.name}",
-                    total_amount=net_salary,
-                    fiscal_year_id=fiscal_year.id,
-                    employee_id=employee.id,
-                    created_by_id=current_user.id,
-                    is_approved=True,
-                    approval_date=datetime.utcnow(),
-                    approved_by_id=current_user.id
-                )
-                
-                db.session.add(transaction)
-                db.session.flush()
-                
-                # قيد مدين: مصروف رواتب
-                debit_entry = TransactionEntry(
-                    transaction_id=transaction.id,
-                    account_id=salary_expense_account.id,
-                    entry_type=EntryType.DEBIT,
-                    amount=net_salary,
-                    description=f"راتب {employee.name}"
-                )
-                db.session.add(debit_entry)
-                
-                # قيد دائن: النقدية
-                credit_entry = TransactionEntry(
-                    transaction_id=transaction.id,
-                    account_id=cash_account.id,
-                    entry_type=EntryType.CREDIT,
-                    amount=net_salary,
-                    description=f"صرف راتب {employee.name}"
-                )
-                db.session.add(credit_entry)
-                
-                # تحديث أرصدة الحسابات
-                salary_expense_account.balance += net_salary
-                cash_account.balance -= net_salary
-                
+                entries.append({
+                    'transaction_date': salary_date,
+                    'transaction_type': TransactionType.SALARY,
+                    'description': f"راتب شهر {form.month.data}/{form.year.data} - {employee.name}",
+                    'employee_id': employee.id,
+                    'lines': [
+                        journal_posting.debit(salary_expense_account.id, net_salary, f"راتب {employee.name}"),
+                        journal_posting.credit(cash_account.id, net_salary, f"صرف راتب {employee.name}")
+                    ]
+                })
                 total_salaries += net_salary
-                processed_count += 1
-                settings.next_transaction_number += 1
+            
+            # ترحيل كل القيود دفعة واحدة
+            journal_posting.post(entries, current_user.id)
+            processed_count = len(entries)
             
             db.session.commit()
             
@@ -302,86 +247,46 @@ def vehicle_expenses():
     
     if form.validate_on_submit():
         try:
-            # الحصول على الحسابات المحاسبية
-            expense_accounts = {
-                'fuel': Account.query.filter_by(code='5101').first(),  # مصروف وقود
-                'maintenance': Account.query.filter_by(code='5102').first(),  # مصروف صيانة
-                'insurance': Account.query.filter_by(code='5103').first(),  # مصروف تأمين
-                'registration': Account.query.filter_by(code='5104').first(),  # مصروف تسجيل
-                'fines': Account.query.filter_by(code='5105').first(),  # مخالفات
-                'other': Account.query.filter_by(code='5199').first()  # مصروفات أخرى
+            # الحسابات المحاسبية باستعلام واحد
+            expense_codes = {
+                'fuel': '5101',  # مصروف وقود
+                'maintenance': '5102',  # مصروف صيانة
+                'insurance': '5103',  # مصروف تأمين
+                'registration': '5104',  # مصروف تسجيل
+                'fines': '5105',  # مخالفات
+                'other': '5199'  # مصروفات أخرى
             }
+            expense_code = expense_codes.get(form.expense_type.data)
+            vendor_code = f"2{int(form.vendor_id.data):03d}" if form.vendor_id.data else None
+            accounts_by_code = {a.code: a for a in Account.query.filter(
+                Account.code.in_([c for c in (expense_code, '1001', vendor_code) if c])
+            ).all()}
             
-            expense_account = expense_accounts.get(form.expense_type.data)
-            cash_account = Account.query.filter_by(code='1001').first()  # النقدية
+            expense_account = accounts_by_code.get(expense_code)
+            cash_account = accounts_by_code.get('1001')  # النقدية
             
             if not expense_account or not cash_account:
                 flash('الحسابات المحاسبية للمصروفات غير موجودة', 'danger')
                 return render_template('accounting/vehicle/expense_form.html', form=form)
             
-            # إعدادات النظام
-            settings = AccountingSettings.query.first()
-            fiscal_year = FiscalYear.query.filter_by(is_active=True).first()
-            
-            transaction_number = f"{settings.transaction_prefix}{settings.next_transaction_number:06d}"
-            
             vehicle = Vehicle.query.get(form.vehicle_id.data)
             
-            # إنشاء المعاملة
-            transaction = Transaction(
-                transaction_number=transaction_number,
-                transaction_date=form.expense_date.data,
-                transaction_type=TransactionType.VEHICLE_EXPENSE,
-                reference_number=form.receipt_number.data if hasattr(form, 'receipt_number') else '',
-                description=form.description.data,
-                total_amount=form.amount.data,
-                fiscal_year_id=fiscal_year.id,
-                vehicle_id=vehicle.id,
-                vendor_id=form.vendor_id.data if form.vendor_id.data else None,
-                created_by_id=current_user.id,
-                is_approved=True,
-                approval_date=datetime.utcnow(),
-                approved_by_id=current_user.id
-            )
-            
-            db.session.add(transaction)
-            db.session.flush()
-            
-            # قيد مدين: مصروف
-            debit_entry = TransactionEntry(
-                transaction_id=transaction.id,
-                account_id=expense_account.id,
-                entry_type=EntryType.DEBIT,
-                amount=form.amount.data,
-                description=f"{form.description.data} - {vehicle.plate_number}"
-            )
-            db.session.add(debit_entry)
-            
-            # قيد دائن: النقدية أو حساب المورد
-            if form.vendor_id.data:
-                vendor = Vendor.query.get(form.vendor_id.data)
-                vendor_account = Account.query.filter_by(code=f"2{vendor.id:03d}").first()
-                if vendor_account:
-                    credit_account = vendor_account
-                else:
-                    credit_account = cash_account
-            else:
-                credit_account = cash_account
-            
-            credit_entry = TransactionEntry(
-                transaction_id=transaction.id,
-                account_id=credit_account.id,
-                entry_type=EntryType.CREDIT,
-                amount=form.amount.data,
-                description=f"دفع {form.description.data}"
-            )
-            db.session.add(credit_entry)
-            
-            # تحديث أرصدة الحسابات
-            expense_account.balance += form.amount.data
-            credit_account.balance -= form.amount.data
-            
-            settings.next_transaction_number += 1
+            # قيد دائن: حساب المورد إن وُجد وإلا النقدية
+            credit_account = accounts_by_code.get(vendor_code) or cash_account
+            
+            journal_posting.post([{
+                'transaction_date': form.expense_date.data,
+                'transaction_type': TransactionType.VEHICLE_EXPENSE,
+                'reference_number': form.receipt_number.data if hasattr(form, 'receipt_number') else '',
+                'description': form.description.data,
+                'vehicle_id': vehicle.id,
+                'vendor_id': form.vendor_id.data if form.vendor_id.data else None,
+                'lines': [
+                    journal_posting.debit(expense_account.id, form.amount.data,
+                                          f"{form.description.data} - {vehicle.plate_number}"),
+                    journal_posting.credit(credit_account.id, form.amount.data, f"دفع {form.description.data}")
+                ]
+            }], current_user.id)
             
             db.session.commit()
             
@@ -420,37 +325,12 @@ def trial_balance():
     if not to_date:
         to_date = date.today().strftime('%Y-%m-%d')
     
-    # استعلام أرصدة الحسابات
-    from sqlalchemy import case
-    
-    accounts_balances = db.session.query(
-        Account.id,
-        Account.code,
-        Account.name,
-        Account.account_type,
-        func.sum(
-            case(
-                (TransactionEntry.entry_type == EntryType.DEBIT, TransactionEntry.amount),
-                else_=0
-            )
-        ).label('total_debits'),
-        func.sum(
-            case(
-                (TransactionEntry.entry_type == EntryType.CREDIT, TransactionEntry.amount),
-                else_=0
-            )
-        ).label('total_credits')
-    ).outerjoin(TransactionEntry).outerjoin(Transaction).filter(
-        or_(Transaction.is_approved == True, Transaction.id.is_(None)),
-        or_(
-            and_(
-                Transaction.transaction_date >= datetime.strptime(from_date, '%Y-%m-%d').date(),
-                Transaction.transaction_date <= datetime.strptime(to_date, '%Y-%m-%d').date()
-            ),
-            Transaction.id.is_(None)
-        ),
-        Account.is_active == True
-    ).group_by(Account.id, Account.code, Account.name, Account.account_type).order_by(Account.code).all()
+    # مجاميع الفترة من اللقطات الشهرية (الأشهر الجزئية فقط من القيود)
+    totals = ledger_balances.period_totals(
+        datetime.strptime(from_date, '%Y-%m-%d').date(),
+        datetime.strptime(to_date, '%Y-%m-%d').date()
+    )
+    accounts_balances = Account.query.filter(Account.is_active == True).order_by(Account.code).all()
     
     # حساب الأرصدة النهائية
     trial_balance_data = []
@@ -458,8 +338,7 @@ def trial_balance():
     total_credits = Decimal('0')
     
     for account in accounts_balances:
-        debits = account.total_debits or Decimal('0')
-        credits = account.total_credits or Decimal('0')
+        debits, credits = totals.get(account.id, (Decimal('0'), Decimal('0')))
         
         # حساب الرصيد حسب نوع الحساب
         if account.account_type in [AccountType.ASSETS, AccountType.EXPENSES]:
@@ -510,27 +389,12 @@ def balance_sheet():
     
     as_of_date = request.args.get('as_of_date', date.today().strftime('%Y-%m-%d'))
     
-    # أرصدة الحسابات كما في تاريخ محدد
-    accounts_query = db.session.query(
-        Account.code,
-        Account.name,
-        Account.account_type,
-        func.sum(
-            func.case(
-                (TransactionEntry.entry_type == EntryType.DEBIT, TransactionEntry.amount),
-                else_=0
-            ) -
-            func.case(
-                (TransactionEntry.entry_type == EntryType.CREDIT, TransactionEntry.amount),
-                else_=0
-            )
-        ).label('balance')
-    ).outerjoin(TransactionEntry).outerjoin(Transaction).filter(
-        Transaction.is_approved == True,
-        Transaction.transaction_date <= datetime.strptime(as_of_date, '%Y-%m-%d').date(),
+    # أرصدة الحسابات كما في تاريخ محدد (من اللقطات الشهرية)
+    totals = ledger_balances.balances_as_of(datetime.strptime(as_of_date, '%Y-%m-%d').date())
+    accounts_query = Account.query.filter(
         Account.is_active == True,
         Account.account_type.in_([AccountType.ASSETS, AccountType.LIABILITIES, AccountType.EQUITY])
-    ).group_by(Account.id).order_by(Account.code).all()
+    ).order_by(Account.code).all()
     
     # تصنيف الحسابات
     assets = []
@@ -542,7 +406,7 @@ def balance_sheet():
     total_equity = Decimal('0')
     
     for account in accounts_query:
-        balance = account.balance or Decimal('0')
+        balance = ledger_balances.natural_balance(account.account_type, *totals.get(account.id, (None, None)))
         
         if account.account_type == AccountType.ASSETS:
             if balance != 0:
@@ -569,16 +433,18 @@ def balance_sheet():
                 })
                 total_equity += abs(balance)
     
-    # حساب الأرباح المحتجزة
-    revenue_total = db.session.query(func.sum(Account.balance)).filter(
-        Account.account_type == AccountType.REVENUE,
-        Account.is_active == True
-    ).scalar() or Decimal('0')
-    
-    expense_total = db.session.query(func.sum(Account.balance)).filter(
-        Account.account_type == AccountType.EXPENSES,
-        Account.is_active == True
-    ).scalar() or Decimal('0')
+    # حساب الأرباح المحتجزة (الإيرادات ناقص المصروفات حتى نفس التاريخ)
+    revenue_total = Decimal('0')
+    expense_total = Decimal('0')
+    for account in Account.query.filter(
+        Account.is_active == True,
+        Account.account_type.in_([AccountType.REVENUE, AccountType.EXPENSES])
+    ).all():
+        balance = ledger_balances.natural_balance(account.account_type, *totals.get(account.id, (None, None)))
+        if account.account_type == AccountType.REVENUE:
+            revenue_total += balance
+        else:
+            expense_total += balance
     
     retained_earnings = revenue_total - expense_total
     total_equity += retained_earnings
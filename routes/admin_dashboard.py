@@ -286,6 +286,20 @@ def api_stats():
     }
     return jsonify(stats)
 
+@admin_dashboard_bp.route('/api/scheduler')
+@login_required
+def api_scheduler():
+    """حالة المهام الخلفية وآخر تشغيلاتها (المدة والسجلات المتأثرة)"""
+    from models import UserRole
+    from services import scheduler
+    if current_user.role != UserRole.ADMIN:
+        return jsonify({'error': 'Unauthorized'}), 403
+    limit = min(request.args.get('limit', 50, type=int), 500)
+    data = scheduler.status()
+    data['runs'] = [scheduler.run_as_dict(run)
+                    for run in scheduler.recent_runs(limit, job_name=request.args.get('job'))]
+    return jsonify(data)
+
 @admin_dashboard_bp.route('/bulk-actions', methods=['POST'])
 @login_required
 @admin_required
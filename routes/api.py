@@ -1,4 +1,5 @@
 from flask import Blueprint, jsonify, request, url_for
+from flask_login import login_required
 from models import Employee, Department, Document, Vehicle, VehicleHandover, VehicleHandoverImage, InspectionUploadToken, VehicleInspectionRecord, VehicleInspectionImage
 from app import db
 import os
@@ -103,6 +104,44 @@ def get_expiring_documents(days):
 
 
 
+@api_bp.route('/search')
+@login_required
+def search():
+    """
+    البحث الموحد في الموظفين والمركبات والوثائق مرتباً حسب الصلة (services/search_index)
+
+    معاملات: q نص البحث، types أنواع مفصولة بفواصل (employee,vehicle,document)، limit لكل نوع
+    """
+    from services import search_index
+
+    term = request.args.get('q', '').strip()
+    types = [t for t in request.args.get('types', 'employee,vehicle,document').split(',') if t in search_index.ENTITIES]
+    limit = min(request.args.get('limit', 10, type=int), 50)
+
+    results = {}
+    for entity in types:
+        matches = search_index.search(entity, term, limit=limit) if term else []
+        model = search_index.ENTITIES[entity][0]
+        objects = {obj.id: obj for obj in model.query.filter(model.id.in_([i for i, _ in matches])).all()} if matches else {}
+        items = []
+        for entity_id, score in matches:
+            obj = objects.get(entity_id)
+            if obj is None:
+                continue
+            if entity == 'employee':
+                item = {'label': obj.name, 'detail': obj.employee_id, 'status': obj.status}
+            elif entity == 'vehicle':
+                item = {'label': obj.plate_number, 'detail': f"{obj.make} {obj.model}", 'status': obj.status}
+            else:
+                item = {'label': search_index.DOCUMENT_TYPE_LABELS.get(obj.document_type, obj.document_type),
+                        'detail': obj.document_number, 'employee_id': obj.employee_id,
+                        'expiry_date': obj.expiry_date.isoformat() if obj.expiry_date else None}
+            items.append({'id': entity_id, 'score': score, **item})
+        results[entity] = items
+
+    return jsonify({'query': term, 'normalized': search_index.normalize(term), 'results': results})
+
+
 @api_bp.route('/employees/nationality/stats')
 def get_nationality_stats():
     """إحصائيات عدد الموظفين حسب الجنسية ونوع العقد"""
@@ -11,7 +11,8 @@ from models import (
     Employee, User
 )
 from utils.storage_helper import upload_image
-from PIL import Image
+from utils.image_pipeline import optimize_image, submit_image
+from routes.notifications import notify_all_users, notify_users, get_all_user_ids
 from pillow_heif import register_heif_opener
 import jwt
 
@@ -26,7 +27,7 @@ api_accident_reports = Blueprint('api_accident_reports', __name__, url_prefix='/
 def test_accident_notifications():
     """اختبار إنشاء إشعارات الحوادث لجميع المستخدمين"""
     try:
-        from models import User, Vehicle
+        from models import Vehicle
         
         # الحصول على آخر حادثة
         last_accident = VehicleAccident.query.order_by(VehicleAccident.id.desc()).first()
@@ -35,36 +36,29 @@ def test_accident_notifications():
             return jsonify({'success': False, 'message': 'لا توجد حوادث'}), 404
         
         vehicle = Vehicle.query.get(last_accident.vehicle_id)
-        all_users = User.query.all()
-        
-        notification_count = 0
-        for user in all_users:
-            try:
-                create_accident_notification(
-                    user_id=user.id,
-                    vehicle_plate=vehicle.plate_number if vehicle else 'غير محدد',
-                    driver_name=last_accident.driver_name or 'غير محدد',
-                    accident_id=last_accident.id,
-                    severity=last_accident.severity or 'متوسط'
-                )
-                notification_count += 1
-            except Exception as e:
-                logger.error(f'خطأ في إنشاء إشعار للمستخدم {user.id}: {str(e)}')
+        user_ids = get_all_user_ids()
+        
+        notification_count = notify_users(user_ids, **accident_notification_fields(
+            vehicle_plate=vehicle.plate_number if vehicle else 'غير محدد',
+            driver_name=last_accident.driver_name or 'غير محدد',
+            accident_id=last_accident.id,
+            severity=last_accident.severity or 'متوسط'
+        ))
+        db.session.commit()
         
         return jsonify({
             'success': True,
             'message': f'تم إنشاء {notification_count} إشعار للحادثة {last_accident.id}',
             'accident_id': last_accident.id,
-            'users_count': len(all_users)
+            'users_count': len(user_ids)
         })
     except Exception as e:
         logger.error(f'خطأ في اختبار الإشعارات: {str(e)}')
         return jsonify({'success': False, 'message': str(e)}), 500
 
 # دالة لإنشاء إشعار الحادثة
-def create_accident_notification(user_id, vehicle_plate, driver_name, accident_id, severity='normal'):
-    """إشعار حادثة سير جديدة"""
-    from models import Notification
+def accident_notification_fields(vehicle_plate, driver_name, accident_id, severity='normal'):
+    """محتوى إشعار حادثة السير (لإرساله لمستخدم واحد أو لعدة مستخدمين)"""
     from flask import url_for
     
     severity_labels = {
@@ -89,8 +83,7 @@ def create_accident_notification(user_id, vehicle_plate, driver_name, accident_i
     
     severity_label = severity_labels.get(severity, severity)
     
-    notification = Notification(
-        user_id=user_id,
+    return dict(
         notification_type='accident',
         title=f'حادثة سير - السيارة {vehicle_plate}',
         description=f'تم تسجيل حادثة سير {severity_label} للسيارة {vehicle_plate} من قبل السائق {driver_name}. يرجى المراجعة والموافقة.',
@@ -99,6 +92,16 @@ def create_accident_notification(user_id, vehicle_plate, driver_name, accident_i
         priority=severity_priority.get(severity, 'normal'),
         action_url=url_for('operations.list_accident_reports')
     )
+
+
+def create_accident_notification(user_id, vehicle_plate, driver_name, accident_id, severity='normal'):
+    """إشعار حادثة سير جديدة"""
+    from models import Notification
+    
+    notification = Notification(
+        user_id=user_id,
+        **accident_notification_fields(vehicle_plate, driver_name, accident_id, severity)
+    )
     db.session.add(notification)
     db.session.commit()
     return notification
@@ -133,23 +136,7 @@ def allowed_file(filename, file_type='image'):
 
 def compress_image(filepath, max_size=(1920, 1920), quality=85):
     """ضغط الصورة وتحويلها إلى JPEG"""
-    try:
-        with Image.open(filepath) as img:
-            if img.mode in ('RGBA', 'LA', 'P'):
-                background = Image.new('RGB', img.size, (255, 255, 255))
-                if img.mode == 'P':
-                    img = img.convert('RGBA')
-                background.paste(img, mask=img.split()[-1] if img.mode in ('RGBA', 'LA') else None)
-                img = background
-            elif img.mode != 'RGB':
-                img = img.convert('RGB')
-            
-            img.thumbnail(max_size, Image.Resampling.LANCZOS)
-            img.save(filepath, 'JPEG', quality=quality, optimize=True)
-            return True
-    except Exception as e:
-        logger.error(f"Error compressing image: {str(e)}")
-        return False
+    return optimize_image(filepath, max_size=max(max_size), quality=quality, to_jpeg=True)
 
 
 def token_required(f):
@@ -360,8 +347,8 @@ def submit_accident_report(current_employee):
                     image_file.save(filepath)
                     logger.info(f"Saved accident image: {filepath}")
                     
-                    # ضغط الصورة
-                    compress_image(filepath)
+                    # ضغط الصورة وإنشاء النسخ المصغرة في الخلفية
+                    submit_image(filepath, to_jpeg=True)
                     
                     # حفظ بيانات الصورة في قاعدة البيانات
                     relative_path = filepath.replace('static/', '')
@@ -379,26 +366,19 @@ def submit_accident_report(current_employee):
         
         # إنشاء إشعارات للمسؤولين عند تسجيل حادثة جديدة
         try:
-            # الحصول على جميع المستخدمين
-            all_users = User.query.all()
-            logger.info(f"Found {len(all_users)} users for accident notifications")
-            
             severity_val = request.form.get('severity', 'متوسط')
             
-            for user in all_users:
-                try:
-                    # استخدام الدالة المحلية create_accident_notification
-                    create_accident_notification(
-                        user_id=user.id,
-                        vehicle_plate=vehicle.plate_number,
-                        driver_name=driver_name,
-                        accident_id=accident.id,
-                        severity=severity_val
-                    )
-                    logger.info(f"Created accident notification for user {user.id}")
-                except Exception as e:
-                    logger.error(f'خطأ في إنشاء إشعار للمستخدم {user.id}: {str(e)}')
+            # إشعار لكل المستخدمين بعبارة INSERT واحدة
+            count = notify_all_users(**accident_notification_fields(
+                vehicle_plate=vehicle.plate_number,
+                driver_name=driver_name,
+                accident_id=accident.id,
+                severity=severity_val
+            ))
+            db.session.commit()
+            logger.info(f"Created {count} accident notifications")
         except Exception as e:
+            db.session.rollback()
             logger.error(f'خطأ في إنشاء إشعارات الحادثة: {str(e)}')
         
         logger.info(f"Accident report {accident.id} submitted by employee {current_employee.employee_id} for vehicle {vehicle.plate_number}")
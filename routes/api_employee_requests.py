@@ -15,6 +15,7 @@ from models import (
     RequestNotification, RequestStatus, RequestType, Vehicle, MediaType, FileType
 )
 from utils.employee_requests_drive_uploader import EmployeeRequestsDriveUploader
+from services import notification_hub, drive_sync
 from werkzeug.utils import secure_filename
 import uuid
 
@@ -635,19 +636,21 @@ def upload_files(current_employee, request_id):
     """
     رفع ملفات (صور أو فيديوهات) لطلب معين
     
+    الملفات تُحفظ محلياً وتُضاف إلى قائمة المزامنة، والرفع إلى Google Drive يتم في
+    الخلفية (services/drive_sync.py). حالة كل ملف متاحة في /requests/<id>/sync-status
+    
     Files:
     - files[]: ملفات متعددة (حتى 500MB لكل ملف)
     
-    Response:
+    Response (202):
     {
         "success": true,
-        "uploaded_files": [...],
-        "google_drive_folder_url": "https://drive.google.com/...",
-        "message": "تم رفع 3 ملفات بنجاح"
+        "uploaded_files": [{"filename": "...", "sync_id": 5, "sync_status": "pending", ...}],
+        "google_drive_folder_url": null,
+        "sync_status_url": "/api/v1/requests/12/sync-status",
+        "message": "تم استلام 3 ملفات وجاري رفعها إلى Google Drive"
     }
     """
-    import tempfile
-    
     emp_request = EmployeeRequest.query.filter_by(
         id=request_id,
         employee_id=current_employee.id
@@ -673,14 +676,6 @@ def upload_files(current_employee, request_id):
             'message': 'لا يوجد ملفات مرفقة'
         }), 400
     
-    drive_uploader = EmployeeRequestsDriveUploader()
-    
-    if not drive_uploader.is_available():
-        return jsonify({
-            'success': False,
-            'message': 'خدمة Google Drive غير متاحة حالياً'
-        }), 503
-    
     type_map = {
         RequestType.INVOICE: 'invoice',
         RequestType.CAR_WASH: 'car_wash',
@@ -695,26 +690,21 @@ def upload_files(current_employee, request_id):
         elif emp_request.request_type == RequestType.CAR_INSPECTION and emp_request.inspection_data and emp_request.inspection_data.vehicle:
             vehicle_number = emp_request.inspection_data.vehicle.plate_number
     
-    vehicle_number_str = vehicle_number if vehicle_number else ''
-    
-    folder_result = drive_uploader.create_request_folder(
+    folder_path = EmployeeRequestsDriveUploader.request_folder_path(
         request_type=type_map.get(emp_request.request_type, 'other'),
         request_id=emp_request.id,
         employee_name=current_employee.name,
-        vehicle_number=vehicle_number_str
+        vehicle_number=vehicle_number if vehicle_number else '',
+        date=emp_request.created_at
     )
     
-    if not folder_result:
-        return jsonify({
-            'success': False,
-            'message': 'فشل إنشاء مجلد على Google Drive'
-        }), 500
-    
-    emp_request.google_drive_folder_id = folder_result['folder_id']
-    emp_request.google_drive_folder_url = folder_result['folder_url']
-    db.session.commit()
+    local_dirs = {
+        RequestType.INVOICE: 'invoices',
+        RequestType.CAR_WASH: 'car_wash',
+        RequestType.CAR_INSPECTION: 'car_inspection',
+    }
     
-    uploaded_files = []
+    queued = []
     
     for file in files:
         if not file.filename or file.filename == '':
@@ -726,45 +716,31 @@ def upload_files(current_employee, request_id):
         if '.' not in file.filename:
             continue
         
-        temp_file = None
-        temp_path = None
+        local_dir = local_dirs.get(emp_request.request_type)
+        if local_dir is None:
+            continue
+        
+        full_path = None
         try:
             file_ext = file.filename.rsplit('.', 1)[1].lower()
+            safe_filename = secure_filename(file.filename) or f"file.{file_ext}"
+            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+            unique_filename = f"{timestamp}_{uuid.uuid4().hex[:8]}_{safe_filename}"
+            local_path = os.path.join('uploads', local_dir, unique_filename)
+            full_path = os.path.join(current_app.static_folder, local_path)
             
-            with tempfile.NamedTemporaryFile(delete=False, suffix=f'.{file_ext}') as temp_file:
-                file.save(temp_file.name)
-                temp_path = temp_file.name
+            os.makedirs(os.path.dirname(full_path), exist_ok=True)
+            file.save(full_path)
+            file_size = os.path.getsize(full_path)
             
-            result = None
-            local_path = None
+            target = None
             
             if emp_request.request_type == RequestType.INVOICE:
-                from werkzeug.utils import secure_filename
-                import shutil
-                
-                safe_filename = secure_filename(file.filename)
-                timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-                unique_filename = f"{timestamp}_{safe_filename}"
-                local_path = os.path.join('uploads', 'invoices', unique_filename)
-                full_path = os.path.join('static', local_path)
-                
-                os.makedirs(os.path.dirname(full_path), exist_ok=True)
-                shutil.copy(temp_path, full_path)
-                
-                result = drive_uploader.upload_invoice_image(
-                    file_path=temp_path,
-                    folder_id=folder_result['folder_id'],
-                    custom_name=file.filename
-                )
-                
                 invoice = emp_request.invoice_data
                 if invoice:
                     invoice.local_image_path = local_path
-                    if result:
-                        invoice.drive_file_id = result['file_id']
-                        invoice.drive_view_url = result['view_url']
-                        invoice.drive_download_url = result.get('download_url')
-                        invoice.file_size = result.get('file_size')
+                    invoice.file_size = file_size
+                    target = ('invoice', invoice.id, 'image')
             
             elif emp_request.request_type == RequestType.CAR_WASH:
                 existing_count = len(emp_request.car_wash_data.media_files) if emp_request.car_wash_data else 0
@@ -772,78 +748,99 @@ def upload_files(current_employee, request_id):
                 
                 if existing_count < 5:
                     media_type = media_types_order[existing_count]
-                    images_dict = {media_type.value: temp_path}
-                    
-                    results = drive_uploader.upload_car_wash_images(
-                        images_dict=images_dict,
-                        folder_id=folder_result['folder_id']
-                    )
-                    
-                    result = results.get(media_type.value)
-                    
-                    if result:
-                        media = CarWashMedia()
-                        media.wash_request_id = emp_request.car_wash_data.id
-                        media.media_type = media_type
-                        media.drive_file_id = result['file_id']
-                        media.drive_view_url = result['view_url']
-                        media.file_size = result.get('file_size')
-                        db.session.add(media)
+                    media = CarWashMedia()
+                    media.wash_request_id = emp_request.car_wash_data.id
+                    media.media_type = media_type
+                    media.local_path = local_path
+                    media.file_size = file_size
+                    db.session.add(media)
+                    emp_request.car_wash_data.media_files.append(media)
+                    db.session.flush()
+                    target = ('car_wash_media', media.id, 'image')
             
             elif emp_request.request_type == RequestType.CAR_INSPECTION:
                 is_video = file_ext in ['mp4', 'mov', 'avi']
-                inspection_file_type = FileType.VIDEO if is_video else FileType.IMAGE
                 
-                if is_video:
-                    result = drive_uploader.upload_large_video_resumable(
-                        file_path=temp_path,
-                        folder_id=folder_result['folder_id'],
-                        filename=file.filename
-                    )
-                else:
-                    results = drive_uploader.upload_inspection_images_batch(
-                        images_list=[temp_path],
-                        folder_id=folder_result['folder_id']
-                    )
-                    result = results[0] if results else None
-                
-                if result:
-                    media = CarInspectionMedia()
-                    media.inspection_request_id = emp_request.inspection_data.id
-                    media.file_type = inspection_file_type
-                    media.drive_file_id = result['file_id']
-                    media.drive_view_url = result['view_url']
-                    media.drive_download_url = result.get('download_url')
-                    media.original_filename = file.filename
-                    media.file_size = result.get('file_size')
-                    media.upload_status = 'completed'
-                    media.upload_progress = 100
-                    db.session.add(media)
+                media = CarInspectionMedia()
+                media.inspection_request_id = emp_request.inspection_data.id
+                media.file_type = FileType.VIDEO if is_video else FileType.IMAGE
+                media.local_path = local_path
+                media.original_filename = file.filename
+                media.file_size = file_size
+                media.upload_status = 'pending'
+                media.upload_progress = 0
+                db.session.add(media)
+                db.session.flush()
+                target = ('car_inspection_media', media.id, 'video' if is_video else 'image')
             
-            if result:
-                uploaded_files.append({
-                    'filename': file.filename,
-                    'drive_url': result['view_url'],
-                    'file_id': result['file_id']
-                })
+            if target is None:
+                os.remove(full_path)
+                continue
+            
+            target_type, target_id, role = target
+            job = drive_sync.enqueue(
+                local_path=os.path.relpath(full_path, drive_sync.PROJECT_ROOT),
+                folder_path=folder_path,
+                target_type=target_type,
+                target_id=target_id,
+                file_name=file.filename,
+                role=role,
+                employee_request_id=emp_request.id
+            )
+            queued.append((file.filename, local_path, job))
         
         except Exception as e:
-            logger.error(f"Error uploading file {file.filename}: {str(e)}")
-            continue
-        finally:
-            if temp_path and os.path.exists(temp_path):
+            logger.error(f"Error saving file {file.filename}: {str(e)}")
+            if full_path and os.path.exists(full_path):
                 try:
-                    os.unlink(temp_path)
-                except:
+                    os.remove(full_path)
+                except OSError:
                     pass
+            continue
     
+    # الحفظ يشغّل عامل المزامنة في الخلفية
     db.session.commit()
     
+    uploaded_files = [{
+        'filename': filename,
+        'local_path': local_path,
+        'sync_id': job.id,
+        'sync_status': job.status,
+        'drive_url': job.drive_view_url,
+        'file_id': job.drive_file_id
+    } for filename, local_path, job in queued]
+    
     return jsonify({
         'success': True,
         'uploaded_files': uploaded_files,
-        'google_drive_folder_url': folder_result['folder_url'],
-        'message': f'تم رفع {len(uploaded_files)} ملف بنجاح إلى Google Drive'
+        'google_drive_folder_url': emp_request.google_drive_folder_url,
+        'sync_status_url': f'/api/v1/requests/{emp_request.id}/sync-status',
+        'message': f'تم استلام {len(uploaded_files)} ملف وجاري رفعها إلى Google Drive'
+    }), 202
+
+
+@api_employee_requests.route('/requests/<int:request_id>/sync-status', methods=['GET'])
+@token_required
+def get_sync_status(current_employee, request_id):
+    """حالة رفع ملفات الطلب إلى Google Drive (لكل ملف: الحالة ونسبة التقدم والرابط)"""
+    emp_request = EmployeeRequest.query.filter_by(
+        id=request_id,
+        employee_id=current_employee.id
+    ).first()
+    
+    if not emp_request:
+        return jsonify({
+            'success': False,
+            'message': 'الطلب غير موجود'
+        }), 404
+    
+    files = [drive_sync.to_dict(job) for job in drive_sync.jobs_for_request(emp_request.id)]
+    
+    return jsonify({
+        'success': True,
+        'files': files,
+        'completed': all(f['status'] == drive_sync.STATUS_DONE for f in files),
+        'google_drive_folder_url': emp_request.google_drive_folder_url
     }), 200
 
 
@@ -1150,10 +1147,7 @@ def get_notifications(current_employee):
             'created_at': notif.created_at.isoformat() if notif.created_at else datetime.utcnow().isoformat()
         })
     
-    unread_count = RequestNotification.query.filter_by(
-        employee_id=current_employee.id,
-        is_read=False
-    ).count()
+    unread_count = notification_hub.unread_count(notification_hub.EMPLOYEE, current_employee.id)
     
     return jsonify({
         'success': True,
@@ -1201,6 +1195,39 @@ def mark_notification_read(current_employee, notification_id):
     }), 200
 
 
+@api_employee_requests.route('/notifications/poll', methods=['GET'])
+@token_required
+def poll_notifications(current_employee):
+    """
+    انتظار طويل لعدد الإشعارات غير المقروءة بدلاً من الاستطلاع المتكرر
+    
+    Query Parameters:
+    - since: الإصدار من الرد السابق؛ يرد فوراً إذا تغير، وإلا ينتظر حتى 25 ثانية
+    
+    Response:
+    {
+        "success": true,
+        "unread_count": 3,
+        "version": 1718000000000000000,
+        "changed": true
+    }
+    """
+    since = request.args.get('since', type=int)
+    version = notification_hub.signal_version(notification_hub.EMPLOYEE, current_employee.id)
+    if since is not None and since == version:
+        db.session.close()
+        version = notification_hub.wait_for_change(
+            notification_hub.EMPLOYEE, current_employee.id, since, timeout=25
+        )
+    
+    return jsonify({
+        'success': True,
+        'unread_count': notification_hub.unread_count(notification_hub.EMPLOYEE, current_employee.id),
+        'version': version,
+        'changed': version != since
+    }), 200
+
+
 @api_employee_requests.route('/employee/liabilities', methods=['GET'])
 @token_required
 def get_employee_liabilities(current_employee):
@@ -3007,14 +3034,9 @@ def get_all_employees_complete_data():
             query = query.join(Employee.departments).filter(Department.id == department_id)
         
         if search_query:
-            search_pattern = f'%{search_query}%'
-            query = query.filter(
-                db.or_(
-                    Employee.name.like(search_pattern),
-                    Employee.employee_id.like(search_pattern),
-                    Employee.national_id.like(search_pattern)
-                )
-            )
+            # من فهرس البحث (يوحد الإملاء العربي ويرتب النتائج حسب الصلة)
+            from services import search_index
+            query = search_index.filter_query(query, 'employee', search_query)
         
         # إجمالي العدد قبل الترقيم
         total_employees = query.count()
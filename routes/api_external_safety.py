@@ -2,7 +2,7 @@ import os
 import jwt
 import logging
 import uuid
-from flask import Blueprint, request, jsonify, current_app
+from flask import Blueprint, request, jsonify
 from werkzeug.security import check_password_hash
 from werkzeug.utils import secure_filename
 from functools import wraps
@@ -13,7 +13,7 @@ from models import (
     Employee, User
 )
 from utils.storage_helper import upload_image
-from PIL import Image
+from utils.image_pipeline import submit_image
 from pillow_heif import register_heif_opener
 
 register_heif_opener()
@@ -36,27 +36,6 @@ def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 
-def compress_image(filepath, max_size=(1920, 1920), quality=85):
-    """ضغط الصورة وتحويلها إلى JPEG"""
-    try:
-        with Image.open(filepath) as img:
-            if img.mode in ('RGBA', 'LA', 'P'):
-                background = Image.new('RGB', img.size, (255, 255, 255))
-                if img.mode == 'P':
-                    img = img.convert('RGBA')
-                background.paste(img, mask=img.split()[-1] if img.mode in ('RGBA', 'LA') else None)
-                img = background
-            elif img.mode != 'RGB':
-                img = img.convert('RGB')
-            
-            img.thumbnail(max_size, Image.Resampling.LANCZOS)
-            img.save(filepath, 'JPEG', quality=quality, optimize=True)
-            return True
-    except Exception as e:
-        logger.error(f"Error compressing image: {str(e)}")
-        return False
-
-
 def token_required(f):
     @wraps(f)
     def decorated(*args, **kwargs):
@@ -274,26 +253,16 @@ def upload_safety_check_image(current_employee, check_id):
         file_ext = safe_filename_str.rsplit('.', 1)[1].lower() if '.' in safe_filename_str else 'jpg'
         filename = f"{uuid.uuid4()}.{file_ext}"
         
-        file_data = file.read()
-        
-        # حفظ مؤقتاً في مجلد آمن بدلاً من /tmp
-        temp_dir = os.path.join(current_app.static_folder, '.temp')
-        os.makedirs(temp_dir, exist_ok=True)
-        temp_path = os.path.join(temp_dir, filename)
-        
-        with open(temp_path, 'wb') as f:
-            f.write(file_data)
-        
-        compress_image(temp_path)
-        
-        with open(temp_path, 'rb') as f:
-            compressed_data = f.read()
-        
-        object_key = upload_image(compressed_data, 'safety_checks', filename)
-        
-        # 💾 الملف المؤقت يبقى محفوظاً في static/.temp/ بشكل دائم
-        
-        file_size = len(compressed_data)
+        # حفظ الصورة على دفعات ثم ضغطها وإنشاء النسخ المصغرة في الخلفية
+        try:
+            object_key = upload_image(file, 'safety_checks', filename, max_bytes=MAX_FILE_SIZE)
+        except ValueError as e:
+            return jsonify({
+                'success': False,
+                'message': str(e)
+            }), 413
+        file_size = os.path.getsize(object_key)
+        submit_image(object_key, to_jpeg=True)
         
         safety_image = VehicleSafetyImage()
         safety_image.safety_check_id = safety_check.id
@@ -6,7 +6,6 @@ from app import db
 from models import Attendance, Employee, Department, SystemAudit, VehicleProject, Module, Permission, employee_departments, EmployeeLocation, GeofenceSession
 from utils.date_converter import parse_date, format_date_hijri, format_date_gregorian
 from utils.excel import export_attendance_by_department
-from utils.excel_dashboard import export_attendance_by_department_with_dashboard
 from utils.user_helpers import check_module_access
 from utils.audit_logger import log_attendance_activity, log_system_activity, log_activity
 from services.attendance_analytics import AttendanceAnalytics
@@ -14,7 +13,8 @@ import calendar
 import logging
 import time as time_module  # Renamed to avoid conflict with datetime.time
 from utils.decorators import module_access_required
-import pandas as pd
+from utils.lazy_imports import lazy_import
+pd = lazy_import('pandas')
 from io import BytesIO
 
 # Setup logging
@@ -433,6 +433,8 @@ def department_attendance():
                 
                 count += 1
             
+            db.session.commit()
+            
             # تسجيل العملية في سجل النشاط
             department = Department.query.get(department_id)
             if department:
@@ -975,6 +977,8 @@ def multi_day_department_attendance():
                 current_date += timedelta(days=1)
                 total_count += day_count
             
+            db.session.commit()
+            
             # تسجيل العملية
             department = Department.query.get(department_id)
             if department:
@@ -1137,6 +1141,7 @@ def stats():
 @attendance_bp.route('/export/excel', methods=['POST', 'GET'])
 def export_excel():
     """تصدير بيانات الحضور إلى ملف Excel"""
+    from utils.excel_dashboard import export_attendance_by_department_with_dashboard
     try:
         # الحصول على البيانات من النموذج حسب طريقة الطلب
         if request.method == 'POST':
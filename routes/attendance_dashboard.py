@@ -5,15 +5,13 @@
 """
 
 from datetime import datetime, timedelta
-import pandas as pd
+from utils.lazy_imports import lazy_import
+pd = lazy_import('pandas')
 from sqlalchemy import func, case, literal, or_
 from flask import Blueprint, render_template, request, jsonify, send_file
 from flask_login import login_required, current_user
 import io
 import os
-import openpyxl
-from openpyxl.chart import BarChart, Reference
-from openpyxl.styles import Font, PatternFill, Alignment
 
 from models import Department, Employee, Attendance, Module, employee_departments
 from app import db
@@ -719,6 +717,8 @@ def live_monitoring():
 @module_access_required(Module.ATTENDANCE)
 def api_live_stats():
     """API endpoint للحصول على الإحصائيات الحية"""
+    from openpyxl.chart import BarChart, Reference
+    from openpyxl.styles import Font, PatternFill, Alignment
     try:
         today = datetime.now().date()
         
@@ -4,9 +4,8 @@ from sqlalchemy import func, and_, or_
 from models import db, MobileDevice, Employee, Department, DeviceAssignment, ImportedPhoneNumber, SimCard
 from datetime import datetime
 import io
-import pandas as pd
-from openpyxl import Workbook
-from openpyxl.styles import Font, PatternFill, Alignment
+from utils.lazy_imports import lazy_import
+pd = lazy_import('pandas')
 
 device_management_bp = Blueprint('device_management', __name__)
 
@@ -73,6 +72,8 @@ def assignment_details_single(device_id):
 @device_management_bp.route('/export-assignment-details')
 def export_assignment_details():
     """تصدير تفاصيل الربط إلى Excel"""
+    from openpyxl import Workbook
+    from openpyxl.styles import Font, PatternFill, Alignment
     try:
         # جلب البيانات
         query = db.session.query(MobileDevice)\
@@ -682,6 +683,8 @@ def unassign_from_employee(device_id):
 @device_management_bp.route('/export-excel')
 def export_excel():
     """تصدير بيانات الأجهزة إلى Excel بناءً على الفلاتر المطبقة"""
+    from openpyxl import Workbook
+    from openpyxl.styles import Font, PatternFill, Alignment
     try:
         # جلب الفلاتر من parameters
         department_filter = request.args.get('department', '')
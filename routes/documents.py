@@ -6,21 +6,11 @@ from datetime import datetime, timedelta
 import io
 from io import BytesIO
 import csv
-import xlsxwriter
-import pandas as pd
-from openpyxl import Workbook
-from openpyxl.styles import Font, Alignment, PatternFill, Border, Side
+from utils.lazy_imports import lazy_import
+xlsxwriter = lazy_import('xlsxwriter')
+pd = lazy_import('pandas')
+arabic_reshaper = lazy_import('arabic_reshaper')
 from flask_login import current_user, login_required
-from reportlab.lib.pagesizes import A4, landscape
-from reportlab.lib import colors
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
-from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.ttfonts import TTFont
-from reportlab.lib.units import cm
-import arabic_reshaper
-from bidi.algorithm import get_display
-from reportlab.platypus import PageBreak
 from app import db
 from models import Document, Employee, Department, SystemAudit
 from utils.excel import parse_document_excel
@@ -31,85 +21,27 @@ import json
 documents_bp = Blueprint('documents', __name__)
 
 
-def create_expiry_notification(user_id, document_type, employee_name, days_until_expiry, document_id):
-    """إشعار انتهاء صلاحية وثيقة"""
-    from models import Notification, User
-    
-    if days_until_expiry < 0:
-        title = f'وثيقة منتهية - {document_type}'
-        description = f'انتهت صلاحية {document_type} للموظف {employee_name} منذ {abs(days_until_expiry)} يوم'
-        priority = 'critical'
-    elif days_until_expiry <= 7:
-        title = f'تنبيه عاجل: وثيقة تنتهي قريباً'
-        description = f'{document_type} للموظف {employee_name} تنتهي خلال {days_until_expiry} أيام'
-        priority = 'critical'
-    elif days_until_expiry <= 30:
-        title = f'تذكير: وثيقة تنتهي خلال شهر'
-        description = f'{document_type} للموظف {employee_name} تنتهي خلال {days_until_expiry} يوماً'
-        priority = 'high'
-    else:
-        title = f'تذكير: وثيقة قريبة من الانتهاء'
-        description = f'{document_type} للموظف {employee_name} تنتهي خلال {days_until_expiry} يوماً'
-        priority = 'normal'
-    
-    notification = Notification(
-        user_id=user_id,
-        notification_type='document_expiry',
-        title=title,
-        description=description,
-        related_entity_type='document',
-        related_entity_id=document_id,
-        priority=priority,
-        action_url=url_for('documents.dashboard')
-    )
-    db.session.add(notification)
-    return notification
-
-
 @documents_bp.route('/test-notifications', methods=['GET', 'POST'])
 def test_expiry_notifications():
-    """اختبار إنشاء إشعارات انتهاء الصلاحيات لجميع المستخدمين"""
+    """تشغيل ماسح انتهاء الصلاحيات الآن (التنبيهات المرسلة سابقاً لا تتكرر)"""
     try:
-        from models import Notification, User
-        
-        current_date = datetime.now().date()
-        warning_date = current_date + timedelta(days=30)
-        
-        # الحصول على وثائق قريبة من الانتهاء أو منتهية
-        expiring_docs = Document.query.join(Employee)\
-            .filter(Document.expiry_date <= warning_date)\
-            .order_by(Document.expiry_date)\
-            .limit(5).all()
+        from services import expiry_scanner
         
-        if not expiring_docs:
+        results = expiry_scanner.scan()
+        matched = sum(stats['matched'] for stats in results.values())
+        if not matched:
             return jsonify({'success': False, 'message': 'لا توجد وثائق منتهية أو قريبة من الانتهاء'}), 404
         
-        all_users = User.query.all()
-        
-        notification_count = 0
-        for doc in expiring_docs:
-            days_until_expiry = (doc.expiry_date - current_date).days if doc.expiry_date else -999
-            
-            for user in all_users:
-                try:
-                    create_expiry_notification(
-                        user_id=user.id,
-                        document_type=doc.document_type or 'وثيقة',
-                        employee_name=doc.employee.name if doc.employee else 'غير محدد',
-                        days_until_expiry=days_until_expiry,
-                        document_id=doc.id
-                    )
-                    notification_count += 1
-                except Exception as e:
-                    pass
-        
-        db.session.commit()
+        alerts = sum(stats['alerts'] for stats in results.values())
+        notification_count = sum(stats['notifications'] for stats in results.values())
         
         return jsonify({
             'success': True,
-            'message': f'تم إنشاء {notification_count} إشعار لـ {len(expiring_docs)} وثيقة',
-            'documents_count': len(expiring_docs),
-            'users_count': len(all_users)
+            'message': f'تم إنشاء {notification_count} إشعار لـ {alerts} تنبيه جديد',
+            'documents_count': results['document']['matched'],
+            'alerts_count': alerts,
+            'notifications_count': notification_count,
+            'sources': results
         })
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
@@ -229,6 +161,13 @@ def update_expiry_date(document_id):
 @login_required
 def document_template_pdf():
     """إنشاء نموذج PDF فارغ للوثائق"""
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib import colors
+    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+    from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
+    from utils.pdf import register_font
+    from reportlab.lib.units import cm
+    from bidi.algorithm import get_display
     try:
         # إنشاء ملف PDF في الذاكرة
         buffer = BytesIO()
@@ -243,7 +182,7 @@ def document_template_pdf():
         
         # تسجيل الخط العربي
         try:
-            pdfmetrics.registerFont(TTFont('Cairo', 'Cairo.ttf'))
+            register_font('Cairo', 'Cairo.ttf')
             arabic_font = 'Cairo'
         except:
             arabic_font = 'Helvetica'
@@ -1562,6 +1501,13 @@ def expiry_stats():
 @documents_bp.route('/employee/<int:employee_id>/export_pdf')
 def export_employee_documents_pdf(employee_id):
     """Export employee documents to PDF"""
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib import colors
+    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+    from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
+    from utils.pdf import register_font
+    from reportlab.lib.units import cm
+    from bidi.algorithm import get_display
     employee = Employee.query.get_or_404(employee_id)
     documents = Document.query.filter_by(employee_id=employee_id).all()
     
@@ -1570,14 +1516,14 @@ def export_employee_documents_pdf(employee_id):
     
     # تسجيل الخط العربي - استخدام خط Amiri لأنه يدعم الربط العربي بشكل ممتاز
     try:
-        pdfmetrics.registerFont(TTFont('ArabicFont', 'static/fonts/Amiri-Regular.ttf'))
-        pdfmetrics.registerFont(TTFont('ArabicFontBold', 'static/fonts/Amiri-Bold.ttf'))
+        register_font('ArabicFont', 'static/fonts/Amiri-Regular.ttf')
+        register_font('ArabicFontBold', 'static/fonts/Amiri-Bold.ttf')
         arabic_font_name = 'ArabicFont'
         arabic_font_bold = 'ArabicFontBold'
     except Exception as e:
         # إذا كان هناك خطأ، نستخدم خط بديل
         try:
-            pdfmetrics.registerFont(TTFont('ArabicFont', 'static/fonts/Cairo.ttf'))
+            register_font('ArabicFont', 'static/fonts/Cairo.ttf')
             arabic_font_name = 'ArabicFont'
             arabic_font_bold = 'ArabicFont'
         except:
@@ -1946,6 +1892,7 @@ def export_employee_documents_excel(employee_id):
 @login_required
 def export_excel():
     """تصدير الوثائق إلى ملف Excel حسب الفلاتر المطبقة"""
+    from openpyxl.styles import Font, Alignment, PatternFill, Border, Side
     try:
         # Get filter parameters (same as index route)
         document_type = request.args.get('document_type', '')
@@ -378,6 +378,34 @@ def browser():
     )
 
 
+@drive_browser_bp.route('/browser/folder/<folder_id>/files')
+@login_required
+def folder_files(folder_id):
+    """محتوى مجلد في Google Drive (من ذاكرة Drive ما لم يتغير المجلد أو يُطلب التحديث)"""
+    from services import drive_cache
+    from services.drive_sync import configured_client
+    
+    client = configured_client()
+    if client is None:
+        return jsonify({'success': False, 'message': 'Google Drive غير مكوّن'}), 503
+    
+    try:
+        items = drive_cache.list_folder(client, folder_id, refresh=request.args.get('refresh') == '1')
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'تعذر عرض المجلد: {str(e)[:200]}'}), 502
+    
+    return jsonify({
+        'success': True,
+        'files': [{
+            'id': item.get('id'),
+            'name': item.get('name'),
+            'is_folder': item.get('mimeType') == 'application/vnd.google-apps.folder',
+            'size': int(item['size']) if item.get('size') else None,
+            'view_url': item.get('webViewLink') or f"https://drive.google.com/drive/folders/{item.get('id')}",
+        } for item in items]
+    })
+
+
 @drive_browser_bp.route('/retry-upload/<record_type>/<int:record_id>')
 @login_required
 def retry_upload(record_type, record_id):
@@ -389,19 +417,19 @@ def retry_upload(record_type, record_id):
             record = VehicleWorkshop.query.get_or_404(record_id)
             VehicleDriveUploader.upload_workshop_record(record)
             db.session.commit()
-            flash('تم إعادة محاولة رفع سجل الورشة بنجاح', 'success')
+            flash('تمت إضافة سجل الورشة إلى قائمة الرفع', 'success')
             
         elif record_type == 'vehicle_handover':
             record = VehicleHandover.query.get_or_404(record_id)
             VehicleDriveUploader.upload_handover_record(record)
             db.session.commit()
-            flash('تم إعادة محاولة رفع عملية التسليم/الاستلام بنجاح', 'success')
+            flash('تمت إضافة عملية التسليم/الاستلام إلى قائمة الرفع', 'success')
             
         elif record_type == 'vehicle_safety':
             record = VehicleExternalSafetyCheck.query.get_or_404(record_id)
             VehicleDriveUploader.upload_safety_check(record)
             db.session.commit()
-            flash('تم إعادة محاولة رفع فحص السلامة بنجاح', 'success')
+            flash('تمت إضافة فحص السلامة إلى قائمة الرفع', 'success')
         else:
             flash('نوع السجل غير صحيح', 'error')
             
@@ -8,7 +8,8 @@ from models_accounting_einvoice import EInvoice, EInvoiceLineItem, EInvoiceAudit
 from models import UserRole, Module
 from datetime import datetime, timedelta
 from sqlalchemy import func, extract
-import qrcode
+from utils.lazy_imports import lazy_import
+qrcode = lazy_import('qrcode')
 from io import BytesIO
 import base64
 
@@ -1,9 +1,11 @@
 """
-مسارات إدارة قائمة الإيميلات المحفوظة محلياً
+مسارات إدارة قائمة الإيميلات الصادرة
 """
-from flask import Blueprint, render_template, request, jsonify, current_app, send_file
+from flask import Blueprint, render_template, request, jsonify, send_file
 from flask_login import login_required, current_user
 from services.fallback_email_service import FallbackEmailService
+from services.email_queue import EmailQueue, STATUS_LABELS, STATUS_FAILED
+from services.blob_store import BlobStore
 import os
 
 email_queue_bp = Blueprint('email_queue', __name__, url_prefix='/email-queue')
@@ -11,11 +13,22 @@ email_queue_bp = Blueprint('email_queue', __name__, url_prefix='/email-queue')
 
 @email_queue_bp.route('/')
 def email_queue_list():
-    """عرض قائمة الإيميلات المحفوظة"""
+    """عرض قائمة الإيميلات المحفوظة (صفحة واحدة باستعلام مفهرس)"""
+    page = request.args.get('page', 1, type=int)
+    status = request.args.get('status') or None
+    if status not in STATUS_LABELS:
+        status = None
+
     fallback_service = FallbackEmailService()
-    emails = fallback_service.get_queued_emails()
-    
-    return render_template('email_queue/list.html', emails=emails)
+    emails = fallback_service.get_queued_emails(page=page, per_page=25, status=status)
+
+    return render_template(
+        'email_queue/list.html',
+        emails=emails,
+        status=status,
+        status_labels=STATUS_LABELS,
+        status_counts=EmailQueue.status_counts()
+    )
 
 
 @email_queue_bp.route('/details/<email_id>')
@@ -24,23 +37,22 @@ def email_details(email_id):
     """عرض تفاصيل إيميل محدد"""
     fallback_service = FallbackEmailService()
     email_data = fallback_service.get_email_details(email_id)
-    
+
     if not email_data:
         return jsonify({'success': False, 'message': 'الإيميل غير موجود'})
-    
+
     return render_template('email_queue/details.html', email=email_data)
 
 
 @email_queue_bp.route('/view/<email_id>')
 def view_email_html(email_id):
     """عرض محتوى HTML للإيميل"""
-    fallback_service = FallbackEmailService()
-    html_file_path = os.path.join(fallback_service.emails_dir, f"{email_id}.html")
-    
-    if not os.path.exists(html_file_path):
+    email = EmailQueue.get(email_id)
+
+    if not email or not email.html_content:
         return "الملف غير موجود", 404
-    
-    return send_file(html_file_path)
+
+    return email.html_content
 
 
 @email_queue_bp.route('/delete/<email_id>', methods=['POST'])
@@ -48,7 +60,7 @@ def view_email_html(email_id):
 def delete_email(email_id):
     """حذف إيميل من القائمة"""
     fallback_service = FallbackEmailService()
-    
+
     if fallback_service.delete_email(email_id):
         return jsonify({
             'success': True,
@@ -61,39 +73,55 @@ def delete_email(email_id):
         })
 
 
+@email_queue_bp.route('/retry/<email_id>', methods=['POST'])
+@login_required
+def retry_email(email_id):
+    """إعادة إيميل فاشل إلى قائمة الإرسال"""
+    email = EmailQueue.get(email_id)
+
+    if not email:
+        return jsonify({'success': False, 'message': 'الإيميل غير موجود'}), 404
+    if email.status != STATUS_FAILED:
+        return jsonify({'success': False, 'message': 'يمكن إعادة إرسال الإيميلات الفاشلة فقط'}), 400
+
+    EmailQueue.retry(email)
+    return jsonify({'success': True, 'message': 'تمت إعادة الإيميل إلى قائمة الإرسال'})
+
+
 @email_queue_bp.route('/download-attachment/<email_id>/<int:attachment_index>')
 def download_attachment(email_id, attachment_index):
     """تحميل مرفق من إيميل محدد"""
-    fallback_service = FallbackEmailService()
-    email_data = fallback_service.get_email_details(email_id)
-    
-    if not email_data or 'attachments' not in email_data:
+    email = EmailQueue.get(email_id)
+
+    if not email:
         return "الإيميل غير موجود", 404
-    
-    if attachment_index >= len(email_data['attachments']):
+
+    if attachment_index >= len(email.attachments):
         return "المرفق غير موجود", 404
-    
-    attachment = email_data['attachments'][attachment_index]
-    attachment_path = attachment.get('file_path')
-    
-    if not attachment_path or not os.path.exists(attachment_path):
+
+    attachment = email.attachments[attachment_index]
+    attachment_path = BlobStore.local_path(attachment.file_path)
+
+    if not os.path.exists(attachment_path):
         return "ملف المرفق غير موجود", 404
-    
+
     return send_file(
         attachment_path,
         as_attachment=True,
-        download_name=attachment.get('filename', 'attachment')
+        download_name=attachment.filename or 'attachment',
+        mimetype=attachment.content_type
     )
 
 
 @email_queue_bp.route('/api/count')
 @login_required
 def get_email_count():
-    """الحصول على عدد الإيميلات المحفوظة"""
-    fallback_service = FallbackEmailService()
-    emails = fallback_service.get_queued_emails()
-    
+    """الحصول على عدد الإيميلات المحفوظة حسب الحالة"""
+    counts = EmailQueue.status_counts()
+    total = sum(counts.values())
+
     return jsonify({
-        'count': len(emails),
-        'recent_count': len([e for e in emails[:5]]),  # آخر 5 إيميلات
-    })
\ No newline at end of file
+        'count': total,
+        'recent_count': min(total, 5),  # آخر 5 إيميلات
+        'by_status': counts,
+    })
@@ -1,20 +1,18 @@
 import os
-import pandas as pd
 from io import BytesIO
-from datetime import datetime, timedelta
+from datetime import datetime
 from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, send_file
 from werkzeug.utils import secure_filename
 from sqlalchemy.exc import IntegrityError
 from flask_login import login_required
 from app import db
-from models import Employee, Department, SystemAudit, Document, Attendance, Salary, Module, Permission, Vehicle, VehicleHandover,User,Nationality, employee_departments, MobileDevice, DeviceAssignment, EmployeeLocation, Geofence
+from models import Employee, Department, SystemAudit, Document, Attendance, Salary, Module, Permission, Vehicle, VehicleHandover,User,Nationality, employee_departments, MobileDevice, DeviceAssignment, Geofence
 from sqlalchemy import func, or_
 from utils.excel import parse_employee_excel, generate_employee_excel, export_employee_attendance_to_excel
 from utils.date_converter import parse_date
 from utils.user_helpers import require_module_access
-from utils.employee_comprehensive_report_updated import generate_employee_comprehensive_pdf, generate_employee_comprehensive_excel
-from utils.employee_basic_report import generate_employee_basic_pdf
 from utils.audit_logger import log_activity
+from services import search_index, tracking_snapshot, trajectories
 
 employees_bp = Blueprint('employees', __name__)
 
@@ -1902,6 +1900,7 @@ def upload_image(id):
 @require_module_access(Module.EMPLOYEES, Permission.VIEW)
 def basic_report(id):
     """تقرير المعلومات الأساسية للموظف"""
+    from utils.employee_basic_report import generate_employee_basic_pdf
     try:
                 # طباعة رسالة تشخيصية
         print("بدء إنشاء التقرير الشامل للموظف")
@@ -1953,6 +1952,7 @@ def basic_report(id):
 @require_module_access(Module.EMPLOYEES, Permission.VIEW)
 def comprehensive_report(id):
     """تقرير شامل عن الموظف بصيغة PDF"""
+    from utils.employee_comprehensive_report_updated import generate_employee_comprehensive_pdf
     try:
         # طباعة رسالة تشخيصية
         print("بدء إنشاء التقرير الشامل للموظف")
@@ -2013,6 +2013,7 @@ def comprehensive_report(id):
 @require_module_access(Module.EMPLOYEES, Permission.VIEW)
 def comprehensive_report_excel(id):
     """تقرير شامل عن الموظف بصيغة Excel"""
+    from utils.employee_comprehensive_report_updated import generate_employee_comprehensive_excel
     try:
         # التحقق من وجود الموظف
         employee = Employee.query.get_or_404(id)
@@ -2070,69 +2071,32 @@ def tracking():
     department_filter = request.args.get('department', '')
     search_query = request.args.get('search', '')
     
-    # بناء استعلام الموظفين النشطين فقط
-    query = Employee.query.filter(Employee.status == 'active').options(
-        db.joinedload(Employee.departments)
-    )
+    # الموظفون النشطون ومواقعهم من لقطة التتبع المشتركة (بدل استعلام المواقع وحساب المسافات لكل زائر)
+    snapshot = tracking_snapshot.current()
+    all_employees = [emp for emp in snapshot.employees.values() if emp.status == 'active']
     
     # تطبيق فلتر القسم
     if department_filter:
-        query = query.join(employee_departments).join(Department).filter(Department.id == department_filter)
+        all_employees = [emp for emp in all_employees
+                         if any(str(d.id) == department_filter for d in emp.departments)]
     
-    # تطبيق فلتر البحث (اسم أو رقم وظيفي)
+    # تطبيق فلتر البحث (اسم أو رقم وظيفي أو هوية أو جوال) من فهرس البحث مرتباً حسب الصلة
     if search_query:
-        query = query.filter(
-            or_(
-                Employee.name.contains(search_query),
-                Employee.employee_id.contains(search_query)
-            )
-        )
-    
-    # جلب جميع الموظفين
-    all_employees = query.all()
-    employee_ids = [emp.id for emp in all_employees]
-    
-    # جلب آخر موقع لكل موظف باستخدام window function في استعلام واحد
-    from sqlalchemy import func as sql_func, and_
-    from sqlalchemy.orm import aliased
-    
-    # استخدام subquery مع ROW_NUMBER للحصول على آخر موقع لكل موظف
-    latest_locations_subq = db.session.query(
-        EmployeeLocation.employee_id,
-        EmployeeLocation.id.label('location_id'),
-        sql_func.row_number().over(
-            partition_by=EmployeeLocation.employee_id,
-            order_by=EmployeeLocation.recorded_at.desc()
-        ).label('rn')
-    ).filter(
-        EmployeeLocation.employee_id.in_(employee_ids)
-    ).subquery()
-    
-    # جلب المواقع الفعلية مع البيانات الكاملة
-    latest_locations_query = db.session.query(
-        EmployeeLocation
-    ).join(
-        latest_locations_subq,
-        and_(
-            EmployeeLocation.id == latest_locations_subq.c.location_id,
-            latest_locations_subq.c.rn == 1
-        )
-    ).all()
-    
-    # بناء dictionary للمواقع حسب employee_id
-    locations_by_employee = {loc.employee_id: loc for loc in latest_locations_query}
+        rank = {employee_id: index for index, employee_id in enumerate(search_index.ids('employee', search_query))}
+        all_employees = sorted((emp for emp in all_employees if emp.id in rank), key=lambda emp: rank[emp.id])
     
     # معالجة الموظفين وحساب الحالات
     employee_locations = {}
     employees_with_location = []
     employees_without_location = []
+    now = datetime.utcnow()
     
     for emp in all_employees:
-        latest_location = locations_by_employee.get(emp.id)
+        latest_location = snapshot.locations.get(emp.id)
         
         if latest_location:
             # حساب عمر الموقع بالدقائق والساعات
-            age_seconds = (datetime.utcnow() - latest_location.recorded_at).total_seconds()
+            age_seconds = (now - latest_location.recorded_at).total_seconds()
             age_minutes = age_seconds / 60
             age_hours = age_seconds / 3600
             
@@ -2154,17 +2118,21 @@ def tracking():
                 status_text = 'غير نشط'
                 connection_status = 'inactive'
             
+            geofence = snapshot.first_geofence.get(emp.id)
+            vehicle = snapshot.vehicles.get(latest_location.vehicle_id)
             employee_locations[emp.id] = {
                 'latitude': latest_location.latitude,
                 'longitude': latest_location.longitude,
-                'accuracy': getattr(latest_location, 'accuracy_m', None), 
+                'accuracy': latest_location.accuracy_m,
                 'recorded_at': latest_location.recorded_at,
                 'age_minutes': age_minutes,
                 'age_hours': age_hours,
                 'color': color,
                 'status_text': status_text,
                 'connection_status': connection_status,
-                'vehicle_id': latest_location.vehicle_id
+                'vehicle_id': latest_location.vehicle_id,
+                'geofence_name': geofence.name if geofence else None,
+                'vehicle_name': vehicle.plate_number if vehicle else None
             }
             employees_with_location.append(emp)
         else:
@@ -2173,95 +2141,36 @@ def tracking():
     # ترتيب: الموظفون الذين لديهم موقع أولاً
     employees = employees_with_location + employees_without_location
     
-    # جلب كل الـ geofences النشطة مرة واحدة لتجنب N+1
-    all_geofences = Geofence.query.filter_by(is_active=True).all()
-    
-    # جلب كل الـ vehicles مرة واحدة
-    vehicle_ids = [loc_data['vehicle_id'] for loc_data in employee_locations.values() if loc_data.get('vehicle_id')]
-    vehicles_dict = {}
-    if vehicle_ids:
-        vehicles = Vehicle.query.filter(Vehicle.id.in_(vehicle_ids)).all()
-        vehicles_dict = {v.id: v for v in vehicles}
-    
-    # حساب المسافات للـ geofences لكل موظف
-    from math import radians, sin, cos, sqrt, atan2
-    
-    for emp_id, location_data in employee_locations.items():
-        # استخدام البيانات المحفوظة بدلاً من جلبها مرة أخرى
-        latest_location = locations_by_employee.get(emp_id)
-        
-        if latest_location:
-            # Check all geofences to see if employee is inside any of them
-            for gf in all_geofences:
-                # Calculate distance using Haversine formula
-                R = 6371000  # Earth radius in meters
-                lat1, lon1 = radians(float(latest_location.latitude)), radians(float(latest_location.longitude))
-                lat2, lon2 = radians(float(gf.center_latitude)), radians(float(gf.center_longitude))
-                dlat = lat2 - lat1
-                dlon = lon2 - lon1
-                a = sin(dlat/2)**2 + cos(lat1) * cos(lat2) * sin(dlon/2)**2
-                c = 2 * atan2(sqrt(a), sqrt(1-a))
-                distance = R * c
-                
-                # If employee is within geofence radius
-                if distance <= gf.radius_meters:
-                    location_data['geofence_name'] = gf.name
-                    break
-            
-            # Get vehicle name if assigned
-            if latest_location.vehicle_id and latest_location.vehicle_id in vehicles_dict:
-                vehicle = vehicles_dict[latest_location.vehicle_id]
-                location_data['vehicle_name'] = vehicle.plate_number
-    
     # تحويل الموظفين إلى قواميس لكي يمكن تحويلها إلى JSON
-    employees_data = []
-    for emp in employees:
-        # Get employee department
-        dept_name = emp.departments[0].name if emp.departments else 'غير محدد'
-        
-        # Get location data if exists
-        location_data = employee_locations.get(emp.id)
-        
-        photo_url = None
-        if emp.profile_image:
-            # المسارات في قاعدة البيانات الآن بدون static/ في البداية
-            # مثال: uploads/employees/1212_profile_20251111_075113.jpg
-            photo_url = f"/{emp.profile_image}"
-        
-        emp_dict = {
-            'id': emp.id,
-            'name': emp.name,
-            'employee_number': emp.employee_id,
-            'photo_url': photo_url,
-            'department_name': dept_name
-        }
-        employees_data.append(emp_dict)
+    employees_data = [{
+        'id': emp.id,
+        'name': emp.name,
+        'employee_number': emp.employee_number,
+        'photo_url': emp.photo_url,
+        'department_name': emp.department.name if emp.department else 'غير محدد'
+    } for emp in employees]
     
     # تحويل employee_locations لكي تكون serializable
     employee_locations_json = {}
     for emp_id, loc_data in employee_locations.items():
         employee_locations_json[emp_id] = {
-            'latitude': float(loc_data['latitude']),
-            'longitude': float(loc_data['longitude']),
+            'latitude': loc_data['latitude'],
+            'longitude': loc_data['longitude'],
             'color': loc_data['color'],
             'status_text': loc_data['status_text'],
-            'connection_status': loc_data.get('connection_status', 'disconnected'),
-            'age_minutes': loc_data.get('age_minutes', 0),
-            'geofence_name': loc_data.get('geofence_name'),
-            'vehicle_name': loc_data.get('vehicle_name')
+            'connection_status': loc_data['connection_status'],
+            'age_minutes': loc_data['age_minutes'],
+            'geofence_name': loc_data['geofence_name'],
+            'vehicle_name': loc_data['vehicle_name']
         }
     
-    # جلب جميع الدوائر الجغرافية النشطة
-    geofences = Geofence.query.filter_by(is_active=True).all()
-    geofences_data = []
-    for gf in geofences:
-        geofences_data.append({
-            'id': gf.id,
-            'name': gf.name,
-            'latitude': float(gf.center_latitude),
-            'longitude': float(gf.center_longitude),
-            'radius': gf.radius_meters
-        })
+    geofences_data = [{
+        'id': gf.id,
+        'name': gf.name,
+        'latitude': gf.center_latitude,
+        'longitude': gf.center_longitude,
+        'radius': gf.radius_meters
+    } for gf in snapshot.geofences]
     
     # جلب جميع الأقسام للفلترة
     departments = Department.query.all()
@@ -2287,144 +2196,8 @@ def tracking():
 @login_required
 def tracking_dashboard():
     """لوحة تحكم مختصرة لإحصائيات التتبع المباشر"""
-    from math import radians, sin, cos, sqrt, atan2
-    from sqlalchemy import func as sql_func, and_
-    
-    cutoff_time_active = datetime.utcnow() - timedelta(hours=1)
-    cutoff_time_location = datetime.utcnow() - timedelta(hours=24)
-    
-    # جلب جميع الموظفين مع الأقسام
-    all_employees = Employee.query.options(db.joinedload(Employee.departments)).all()
-    employee_ids = [emp.id for emp in all_employees]
-    
-    # جلب آخر موقع لكل موظف باستخدام window function
-    latest_locations_subq = db.session.query(
-        EmployeeLocation.employee_id,
-        EmployeeLocation.id.label('location_id'),
-        sql_func.row_number().over(
-            partition_by=EmployeeLocation.employee_id,
-            order_by=EmployeeLocation.recorded_at.desc()
-        ).label('rn')
-    ).filter(
-        EmployeeLocation.employee_id.in_(employee_ids)
-    ).subquery()
-    
-    latest_locations_query = db.session.query(
-        EmployeeLocation
-    ).join(
-        latest_locations_subq,
-        and_(
-            EmployeeLocation.id == latest_locations_subq.c.location_id,
-            latest_locations_subq.c.rn == 1
-        )
-    ).all()
-    
-    # بناء dictionary للمواقع
-    locations_by_employee = {loc.employee_id: loc for loc in latest_locations_query}
-    
-    # معالجة الموظفين
-    active_employees = []
-    inactive_employees = []
-    employees_with_vehicles = []
-    
-    for emp in all_employees:
-        latest_location = locations_by_employee.get(emp.id)
-        
-        if latest_location and latest_location.recorded_at >= cutoff_time_active:
-            active_employees.append({
-                'employee': emp,
-                'location': latest_location,
-                'departments': [d.name for d in emp.departments]
-            })
-            
-            if latest_location.vehicle_id:
-                employees_with_vehicles.append({
-                    'employee': emp,
-                    'location': latest_location,
-                    'vehicle': latest_location.vehicle
-                })
-        else:
-            inactive_employees.append(emp)
-    
-    # جلب الـ geofences مرة واحدة
-    all_geofences = Geofence.query.filter_by(is_active=True).all()
-    
-    employees_inside_geofences = []
-    employees_outside_geofences = []
-    geofence_stats = []
-    employees_inside_any_geofence = set()
-    
-    # حساب المسافات لكل geofence
-    for geofence in all_geofences:
-        inside_count = 0
-        inside_employees = []
-        
-        for emp in all_employees:
-            latest_location = locations_by_employee.get(emp.id)
-            
-            if latest_location and latest_location.recorded_at >= cutoff_time_location:
-                lat1, lon1 = float(latest_location.latitude), float(latest_location.longitude)
-                lat2, lon2 = float(geofence.center_latitude), float(geofence.center_longitude)
-                
-                R = 6371000
-                dlat = radians(lat2 - lat1)
-                dlon = radians(lon2 - lon1)
-                a = sin(dlat/2)**2 + cos(radians(lat1)) * cos(radians(lat2)) * sin(dlon/2)**2
-                c = 2 * atan2(sqrt(a), sqrt(1-a))
-                distance = R * c
-                
-                if distance <= geofence.radius_meters:
-                    inside_count += 1
-                    inside_employees.append({
-                        'employee': emp,
-                        'location': latest_location,
-                        'distance': distance
-                    })
-                    employees_inside_any_geofence.add(emp.id)
-        
-        geofence_stats.append({
-            'geofence': geofence,
-            'inside_count': inside_count,
-            'inside_employees': inside_employees
-        })
-    
-    # تحديد الموظفين داخل وخارج الـ geofences
-    for emp in all_employees:
-        latest_location = locations_by_employee.get(emp.id)
-        
-        if latest_location and latest_location.recorded_at >= cutoff_time_location:
-            if emp.id in employees_inside_any_geofence:
-                if not any(e['employee'].id == emp.id for e in employees_inside_geofences):
-                    employees_inside_geofences.append({
-                        'employee': emp,
-                        'location': latest_location
-                    })
-            else:
-                employees_outside_geofences.append({
-                    'employee': emp,
-                    'location': latest_location
-                })
-    
-    stats = {
-        'total_employees': len(all_employees),
-        'active_count': len(active_employees),
-        'inactive_count': len(inactive_employees),
-        'with_vehicles_count': len(employees_with_vehicles),
-        'inside_geofences_count': len(employees_inside_geofences),
-        'outside_geofences_count': len(employees_outside_geofences),
-        'total_geofences': len(all_geofences)
-    }
-    
-    return render_template(
-        'employees/tracking_dashboard.html',
-        stats=stats,
-        active_employees=active_employees,
-        inactive_employees=inactive_employees,
-        employees_with_vehicles=employees_with_vehicles,
-        employees_inside_geofences=employees_inside_geofences,
-        employees_outside_geofences=employees_outside_geofences,
-        geofence_stats=geofence_stats
-    )
+    # الإحصائيات من لقطة التتبع المشتركة؛ أسماء المتغيرات كما يتوقعها القالب
+    return render_template('employees/tracking_dashboard.html', **tracking_snapshot.overview())
 
 
 def format_time_12hr_arabic(dt):
@@ -2469,33 +2242,14 @@ def track_history(id):
         else:
             employee_photo_url = url_for('static', filename=f'uploads/{employee.profile_image}', _external=False)
     
-    cutoff_time = datetime.utcnow() - timedelta(hours=24)
-    
-    locations = EmployeeLocation.query.filter(
-        EmployeeLocation.employee_id == id,
-        EmployeeLocation.recorded_at >= cutoff_time
-    ).order_by(EmployeeLocation.recorded_at.asc()).all()
-    
-    locations_data = []
-    for loc in locations:
-        loc_dict = {
-            'latitude': float(loc.latitude),
-            'longitude': float(loc.longitude),
-            'speed': float(loc.speed_kmh) if loc.speed_kmh else 0,
-            'vehicle_id': loc.vehicle_id,
-            'recorded_at': format_time_12hr_arabic(loc.recorded_at),
-            'accuracy': float(loc.accuracy_m) if loc.accuracy_m else None
-        }
-        
-        if loc.vehicle_id and loc.vehicle:
-            loc_dict['vehicle'] = {
-                'id': loc.vehicle.id,
-                'plate_number': loc.vehicle.plate_number,
-                'make': loc.vehicle.make,
-                'model': loc.vehicle.model
-            }
-        
-        locations_data.append(loc_dict)
+    # الرحلات والوقفات والهندسة المبسطة من محرك المسارات (مخزنة لكل موظف ويوم)
+    history = trajectories.recent(id, hours=24)
+    timeline = trajectories.timeline(history)
+    for item in timeline:
+        item['start_text'] = format_time_12hr_arabic(item['start'])
+        item['end_text'] = format_time_12hr_arabic(item['end'])
+        item['vehicle'] = history['vehicles'].get(item.get('vehicle_id'))
+    timeline_json = [{key: value for key, value in item.items() if key not in ('start', 'end')} for item in timeline]
     
     departments = Department.query.all()
     
@@ -2503,7 +2257,10 @@ def track_history(id):
         'employees/track_history.html',
         employee=employee,
         employee_photo_url=employee_photo_url,
-        locations=locations_data,
+        timeline=timeline,
+        timeline_json=timeline_json,
+        zoom_levels=trajectories.ZOOM_LEVELS,
+        stats=history['stats'],
         departments=departments
     )
 
@@ -2520,7 +2277,7 @@ def export_track_history_pdf(employee_id):
     from reportlab.lib.units import cm
     from reportlab.lib.enums import TA_RIGHT, TA_CENTER
     from reportlab.pdfbase import pdfmetrics
-    from reportlab.pdfbase.ttfonts import TTFont
+    from utils.pdf import register_font
     from arabic_reshaper import reshape
     from bidi.algorithm import get_display
     import requests
@@ -2533,14 +2290,12 @@ def export_track_history_pdf(employee_id):
     
     employee = Employee.query.get_or_404(employee_id)
     
-    cutoff_time = datetime.utcnow() - timedelta(hours=24)
-    locations = EmployeeLocation.query.filter(
-        EmployeeLocation.employee_id == employee_id,
-        EmployeeLocation.recorded_at >= cutoff_time
-    ).order_by(EmployeeLocation.recorded_at.asc()).all()
+    history = trajectories.recent(employee_id, hours=24)
+    timeline = trajectories.timeline(history)
+    stats = history['stats']
     
-    pdfmetrics.registerFont(TTFont('Amiri', 'static/fonts/Amiri-Regular.ttf'))
-    pdfmetrics.registerFont(TTFont('AmiriBold', 'static/fonts/Amiri-Bold.ttf'))
+    register_font('Amiri', 'static/fonts/Amiri-Regular.ttf')
+    register_font('AmiriBold', 'static/fonts/Amiri-Bold.ttf')
     pdfmetrics.registerFontFamily('Amiri', normal='Amiri', bold='AmiriBold')
     
     buffer = BytesIO()
@@ -2589,7 +2344,7 @@ def export_track_history_pdf(employee_id):
     info_data = [
         [prepare_arabic('رقم الموظف:'), prepare_arabic(str(employee.employee_id))],
         [prepare_arabic('الاسم:'), prepare_arabic(employee.name)],
-        [prepare_arabic('عدد النقاط:'), str(len(locations))],
+        [prepare_arabic('عدد النقاط:'), str(stats['points'])],
         [prepare_arabic('التاريخ:'), datetime.now().strftime('%Y-%m-%d %H:%M')],
     ]
     
@@ -2616,33 +2371,17 @@ def export_track_history_pdf(employee_id):
     story.append(info_table)
     story.append(Spacer(1, 1*cm))
     
-    if locations and len(locations) > 0:
-        max_speed = max([float(loc.speed_kmh) if loc.speed_kmh else 0 for loc in locations])
-        total_distance = 0
-        vehicle_count = sum([1 for loc in locations if loc.vehicle_id])
-        
-        for i in range(1, len(locations)):
-            prev = locations[i-1]
-            curr = locations[i]
-            lat1, lon1 = float(prev.latitude), float(prev.longitude)
-            lat2, lon2 = float(curr.latitude), float(curr.longitude)
-            
-            from math import radians, sin, cos, sqrt, atan2
-            R = 6371
-            dlat = radians(lat2 - lat1)
-            dlon = radians(lon2 - lon1)
-            a = sin(dlat/2)**2 + cos(radians(lat1)) * cos(radians(lat2)) * sin(dlon/2)**2
-            c = 2 * atan2(sqrt(a), sqrt(1-a))
-            total_distance += R * c
-        
+    if timeline:
         subtitle = prepare_arabic('إحصائيات التحركات')
         story.append(Paragraph(subtitle, subtitle_style))
         story.append(Spacer(1, 0.3*cm))
         
         stats_data = [
-            [prepare_arabic('إجمالي المسافة:'), f"{total_distance:.2f} " + prepare_arabic('كم')],
-            [prepare_arabic('أقصى سرعة:'), f"{max_speed:.1f} " + prepare_arabic('كم/س')],
-            [prepare_arabic('عدد النقاط على سيارة:'), str(vehicle_count)],
+            [prepare_arabic('إجمالي المسافة:'), f"{stats['distance_km']:.2f} " + prepare_arabic('كم')],
+            [prepare_arabic('أقصى سرعة:'), f"{stats['max_speed']:.1f} " + prepare_arabic('كم/س')],
+            [prepare_arabic('الرحلات / الوقفات:'), f"{len(history['trips'])} / {len(history['stops'])}"],
+            [prepare_arabic('زمن الحركة / التوقف:'), f"{stats['moving_minutes']} / {stats['stopped_minutes']} " + prepare_arabic('دقيقة')],
+            [prepare_arabic('عدد النقاط على سيارة:'), str(stats['vehicle_points'])],
         ]
         
         stats_table = Table(stats_data, colWidths=[4.5*cm, 12*cm])
@@ -2671,32 +2410,40 @@ def export_track_history_pdf(employee_id):
         data = [[
             prepare_arabic('#'),
             prepare_arabic('الوقت'),
-            prepare_arabic('الإحداثيات'),
-            prepare_arabic('السرعة'),
+            prepare_arabic('الموقع'),
+            prepare_arabic('الحركة'),
             prepare_arabic('السيارة'),
         ]]
         
-        for idx, loc in enumerate(locations, 1):
-            coords = f"{float(loc.latitude):.6f}, {float(loc.longitude):.6f}"
-            coords_link = f'<link href="https://www.google.com/maps?q={float(loc.latitude)},{float(loc.longitude)}" color="#2563eb"><u>{coords}</u></link>'
-            
-            speed_val = f"{float(loc.speed_kmh):.1f} " + prepare_arabic('كم/س') if loc.speed_kmh and float(loc.speed_kmh) > 0 else "-"
+        for idx, item in enumerate(timeline, 1):
+            if item['kind'] == 'stop':
+                coords = f"{item['latitude']:.6f}, {item['longitude']:.6f}"
+                maps_url = f"https://www.google.com/maps?q={item['latitude']},{item['longitude']}"
+                movement = prepare_arabic(f"وقفة {item['duration_minutes']:.0f} دقيقة")
+            else:
+                points = item['geometry'][trajectories.ZOOM_LEVELS[0]]
+                coords = f"{points[0][0]:.5f}, {points[0][1]:.5f} → {points[-1][0]:.5f}, {points[-1][1]:.5f}"
+                maps_url = f"https://www.google.com/maps/dir/{points[0][0]},{points[0][1]}/{points[-1][0]},{points[-1][1]}"
+                mode = 'قيادة' if item['mode'] == 'driving' else 'مشي'
+                movement = prepare_arabic(f"{mode} {item['distance_km']:.2f} كم - {item['avg_speed']:.0f} كم/س")
+            coords_link = f'<link href="{maps_url}" color="#2563eb"><u>{coords}</u></link>'
             
             vehicle_info = "-"
-            if loc.vehicle_id and loc.vehicle:
-                vehicle_info = prepare_arabic(f"{loc.vehicle.plate_number} - {loc.vehicle.make}")
+            vehicle = history['vehicles'].get(item.get('vehicle_id'))
+            if vehicle:
+                vehicle_info = prepare_arabic(f"{vehicle['plate_number']} - {vehicle['make']}")
             
-            time_str = format_time_12hr_arabic(loc.recorded_at)
+            time_str = f"{item['start'].strftime('%H:%M')} - {item['end'].strftime('%H:%M')}"
             
             data.append([
                 str(idx),
                 time_str,
                 Paragraph(coords_link, normal_style),
-                speed_val,
+                movement,
                 vehicle_info,
             ])
         
-        table = Table(data, colWidths=[1.2*cm, 3.5*cm, 5*cm, 3*cm, 4.5*cm])
+        table = Table(data, colWidths=[1*cm, 2.7*cm, 6*cm, 4*cm, 3.5*cm])
         table.setStyle(TableStyle([
             ('FONT', (0, 0), (-1, 0), 'AmiriBold', 13),
             ('FONT', (0, 1), (-1, -1), 'Amiri', 11),
@@ -2743,16 +2490,13 @@ def export_track_history_excel(employee_id):
     from openpyxl.chart import BarChart, Reference, LineChart
     import requests
     from io import BytesIO
-    from math import radians, sin, cos, sqrt, atan2
     import os
     
     employee = Employee.query.get_or_404(employee_id)
     
-    cutoff_time = datetime.utcnow() - timedelta(hours=24)
-    locations = EmployeeLocation.query.filter(
-        EmployeeLocation.employee_id == employee_id,
-        EmployeeLocation.recorded_at >= cutoff_time
-    ).order_by(EmployeeLocation.recorded_at.asc()).all()
+    history = trajectories.recent(employee_id, hours=24)
+    timeline = trajectories.timeline(history)
+    stats = history['stats']
     
     wb = Workbook()
     ws = wb.active
@@ -2808,24 +2552,7 @@ def export_track_history_excel(employee_id):
     
     current_row += 1
     
-    if locations and len(locations) > 0:
-        max_speed = max([float(loc.speed_kmh) if loc.speed_kmh else 0 for loc in locations])
-        total_distance = 0
-        vehicle_count = sum([1 for loc in locations if loc.vehicle_id])
-        
-        for i in range(1, len(locations)):
-            prev = locations[i-1]
-            curr = locations[i]
-            lat1, lon1 = float(prev.latitude), float(prev.longitude)
-            lat2, lon2 = float(curr.latitude), float(curr.longitude)
-            
-            R = 6371
-            dlat = radians(lat2 - lat1)
-            dlon = radians(lon2 - lon1)
-            a = sin(dlat/2)**2 + cos(radians(lat1)) * cos(radians(lat2)) * sin(dlon/2)**2
-            c = 2 * atan2(sqrt(a), sqrt(1-a))
-            total_distance += R * c
-        
+    if timeline:
         ws.merge_cells(f'A{current_row}:D{current_row}')
         ws[f'A{current_row}'] = "📊 إحصائيات التحركات"
         ws[f'A{current_row}'].font = Font(name='Arial', size=14, bold=True, color='FFFFFF')
@@ -2835,8 +2562,9 @@ def export_track_history_excel(employee_id):
         
         current_row += 1
         stats_data = [
-            ['عدد نقاط التتبع:', len(locations), 'إجمالي المسافة:', f"{total_distance:.2f} كم"],
-            ['أقصى سرعة:', f"{max_speed:.1f} كم/س", 'نقاط على سيارة:', vehicle_count],
+            ['عدد نقاط التتبع:', stats['points'], 'إجمالي المسافة:', f"{stats['distance_km']:.2f} كم"],
+            ['أقصى سرعة:', f"{stats['max_speed']:.1f} كم/س", 'نقاط على سيارة:', stats['vehicle_points']],
+            ['الرحلات / الوقفات:', f"{len(history['trips'])} / {len(history['stops'])}", 'الحركة / التوقف (دقيقة):', f"{stats['moving_minutes']} / {stats['stopped_minutes']}"],
         ]
         
         for row_data in stats_data:
@@ -2868,9 +2596,17 @@ def export_track_history_excel(employee_id):
         ws[f'F{map_row}'].alignment = Alignment(horizontal='center', vertical='center')
         ws.row_dimensions[map_row].height = 28
         
-        if len(locations) > 0:
-            lats = [float(loc.latitude) for loc in locations]
-            lons = [float(loc.longitude) for loc in locations]
+        # المسار المبسط بأقل مستوى تكبير يكفي لخريطة ثابتة بهذا الحجم
+        route_points = []
+        for item in timeline:
+            if item['kind'] == 'stop':
+                route_points.append([item['latitude'], item['longitude']])
+            else:
+                route_points.extend(item['geometry'][trajectories.ZOOM_LEVELS[0]])
+        
+        if route_points:
+            lats = [point[0] for point in route_points]
+            lons = [point[1] for point in route_points]
             center_lat = sum(lats) / len(lats)
             center_lon = sum(lons) / len(lons)
             
@@ -2947,7 +2683,7 @@ def export_track_history_excel(employee_id):
         
         table_start_row += 1
         
-        headers = ['#', 'الوقت', 'خط العرض', 'خط الطول', 'السرعة (كم/س)', 'الحالة', 'السيارة', 'الدقة (م)', 'رابط الموقع', 'ملاحظات']
+        headers = ['#', 'من', 'إلى', 'المسافة (كم)', 'السرعة (كم/س)', 'الحالة', 'السيارة', 'المدة (دقيقة)', 'رابط الموقع', 'ملاحظات']
         for col_idx, header in enumerate(headers, 1):
             cell = ws.cell(row=table_start_row, column=col_idx)
             cell.value = header
@@ -2962,46 +2698,49 @@ def export_track_history_excel(employee_id):
             )
         ws.row_dimensions[table_start_row].height = 30
         
-        for idx, loc in enumerate(locations, 1):
+        for idx, item in enumerate(timeline, 1):
             row = table_start_row + idx
-            
-            speed_val = float(loc.speed_kmh) if loc.speed_kmh else 0
+            is_stop = item['kind'] == 'stop'
+            speed_val = 0 if is_stop else item['max_speed']
             
             ws.cell(row=row, column=1).value = idx
-            ws.cell(row=row, column=2).value = format_time_12hr_arabic(loc.recorded_at)
-            ws.cell(row=row, column=3).value = float(loc.latitude)
-            ws.cell(row=row, column=4).value = float(loc.longitude)
-            ws.cell(row=row, column=5).value = f"{speed_val:.1f}" if speed_val > 0 else "-"
+            ws.cell(row=row, column=2).value = format_time_12hr_arabic(item['start'])
+            ws.cell(row=row, column=3).value = format_time_12hr_arabic(item['end'])
+            ws.cell(row=row, column=4).value = "-" if is_stop else item['distance_km']
+            ws.cell(row=row, column=5).value = "-" if is_stop else f"{item['avg_speed']:.1f} / {item['max_speed']:.1f}"
             
-            if speed_val > 100:
+            if is_stop:
+                ws.cell(row=row, column=6).value = "⏸️ متوقف"
+                status_color = 'E0E7FF'
+            elif speed_val > 100:
                 ws.cell(row=row, column=6).value = "⚠️ سرعة عالية"
                 status_color = 'FEE2E2'
-            elif speed_val > 60:
-                ws.cell(row=row, column=6).value = "⚡ متوسطة"
+            elif item['mode'] == 'driving':
+                ws.cell(row=row, column=6).value = "🚗 قيادة"
                 status_color = 'FEF3C7'
-            elif speed_val > 0:
-                ws.cell(row=row, column=6).value = "✅ عادية"
-                status_color = 'D1FAE5'
             else:
-                ws.cell(row=row, column=6).value = "⏸️ متوقف"
-                status_color = 'E0E7FF'
+                ws.cell(row=row, column=6).value = "🚶 مشي"
+                status_color = 'D1FAE5'
             
-            if loc.vehicle_id and loc.vehicle:
-                ws.cell(row=row, column=7).value = f"🚗 {loc.vehicle.plate_number} - {loc.vehicle.make}"
+            vehicle = history['vehicles'].get(item.get('vehicle_id'))
+            if vehicle:
+                ws.cell(row=row, column=7).value = f"🚗 {vehicle['plate_number']} - {vehicle['make']}"
             else:
                 ws.cell(row=row, column=7).value = "-"
             
-            ws.cell(row=row, column=8).value = f"{float(loc.accuracy_m):.1f}" if loc.accuracy_m else "-"
+            ws.cell(row=row, column=8).value = item['duration_minutes']
             
-            maps_link = f"https://www.google.com/maps?q={float(loc.latitude)},{float(loc.longitude)}"
+            if is_stop:
+                maps_link = f"https://www.google.com/maps?q={item['latitude']},{item['longitude']}"
+            else:
+                points = item['geometry'][trajectories.ZOOM_LEVELS[0]]
+                maps_link = f"https://www.google.com/maps/dir/{points[0][0]},{points[0][1]}/{points[-1][0]},{points[-1][1]}"
             ws.cell(row=row, column=9).value = "📍 عرض الموقع"
             ws.cell(row=row, column=9).hyperlink = maps_link
             ws.cell(row=row, column=9).font = Font(name='Arial', size=10, color='2563EB', underline='single', bold=True)
             
             if speed_val > 120:
                 ws.cell(row=row, column=10).value = "⚠️ تجاوز السرعة القصوى"
-            elif loc.accuracy_m and float(loc.accuracy_m) > 50:
-                ws.cell(row=row, column=10).value = "⚠️ دقة منخفضة"
             else:
                 ws.cell(row=row, column=10).value = "-"
             
@@ -3035,9 +2774,9 @@ def export_track_history_excel(employee_id):
     
     ws.column_dimensions['A'].width = 6
     ws.column_dimensions['B'].width = 22
-    ws.column_dimensions['C'].width = 14
+    ws.column_dimensions['C'].width = 22
     ws.column_dimensions['D'].width = 14
-    ws.column_dimensions['E'].width = 13
+    ws.column_dimensions['E'].width = 15
     ws.column_dimensions['F'].width = 13
     ws.column_dimensions['G'].width = 22
     ws.column_dimensions['H'].width = 12
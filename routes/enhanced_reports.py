@@ -12,8 +12,6 @@ from utils.excel import generate_employee_excel, generate_salary_excel
 # استخدام مولد PDF البسيط الذي يتجنب مشاكل الترميز
 # from utils.simple_pdf_generator import generate_salary_report_pdf
 # استيراد الدوال المتبقية من الملفات المناسبة
-from utils.simple_pdf_generator import create_vehicle_handover_pdf as generate_vehicle_handover_pdf
-from utils.salary_notification import generate_salary_notification_pdf
 
 # إنشاء موجه المسارات
 enhanced_reports_bp = Blueprint('enhanced_reports', __name__)
@@ -44,6 +42,7 @@ def salaries_pdf():
     """
     تصدير تقرير الرواتب إلى PDF باستخدام النسخة المحسنة
     """
+    from utils.salary_notification import generate_salary_notification_pdf
     # الحصول على معلمات الفلتر
     current_year = datetime.now().year
     current_month = datetime.now().month
@@ -167,6 +166,7 @@ def salary_notification_pdf(salary_id):
     """
     إنشاء إشعار راتب فردي كملف PDF
     """
+    from utils.salary_notification import generate_salary_notification_pdf
     # الحصول على الراتب
     salary = Salary.query.get_or_404(salary_id)
     
@@ -3,15 +3,15 @@ from werkzeug.utils import secure_filename
 import os
 import uuid
 from datetime import datetime
-from PIL import Image
 from pillow_heif import register_heif_opener
 
 # تسجيل plugin الـ HEIC/HEIF للتعامل مع صور الآيفون
 register_heif_opener()
-from models import VehicleExternalSafetyCheck, VehicleSafetyImage, Vehicle, Employee, User, UserRole, VehicleHandover
+from models import VehicleExternalSafetyCheck, VehicleSafetyImage, Vehicle, Employee, UserRole, VehicleHandover
 from app import db
 from utils.audit_logger import log_audit
 from utils.storage_helper import upload_image, delete_image
+from utils.image_pipeline import submit_image
 from utils.vehicle_drive_uploader import VehicleDriveUploader
 from flask_login import current_user, login_required
 from sqlalchemy import func, select
@@ -22,11 +22,11 @@ import resend
 
 # تم نقل whatsapp_service إلى app.py لاستخدامه بشكل مركزي
 
+from routes.notifications import notify_all_users, notify_users, get_all_user_ids
+
 # دوال الإشعارات المحلية
-def create_safety_check_notification(user_id, vehicle_plate, supervisor_name, check_status, check_id):
-    """إشعار فحص السلامة الخارجية"""
-    from models import Notification
-    
+def safety_check_notification_fields(vehicle_plate, supervisor_name, check_status, check_id):
+    """محتوى إشعار فحص السلامة الخارجية (لإرساله لمستخدم واحد أو لعدة مستخدمين)"""
     status_labels = {
         'pending': 'قيد الانتظار',
         'under_review': 'قيد المراجعة',
@@ -43,8 +43,7 @@ def create_safety_check_notification(user_id, vehicle_plate, supervisor_name, ch
     
     status_label = status_labels.get(check_status, check_status)
     
-    notification = Notification(
-        user_id=user_id,
+    return dict(
         notification_type='safety_check',
         title=f'فحص السلامة - السيارة {vehicle_plate}',
         description=f'طلب فحص السلامة الخارجية للسيارة {vehicle_plate} من قبل {supervisor_name} - الحالة: {status_label}',
@@ -53,6 +52,16 @@ def create_safety_check_notification(user_id, vehicle_plate, supervisor_name, ch
         priority=priority_map.get(check_status, 'normal'),
         action_url=url_for('external_safety.admin_external_safety_checks')
     )
+
+
+def create_safety_check_notification(user_id, vehicle_plate, supervisor_name, check_status, check_id):
+    """إشعار فحص السلامة الخارجية"""
+    from models import Notification
+    
+    notification = Notification(
+        user_id=user_id,
+        **safety_check_notification_fields(vehicle_plate, supervisor_name, check_status, check_id)
+    )
     db.session.add(notification)
     db.session.commit()
     return notification
@@ -106,27 +115,21 @@ def test_safety_check_notifications():
         if not last_check:
             return jsonify({'success': False, 'message': 'لا توجد فحوصات سلامة'}), 404
         
-        all_users = User.query.all()
+        user_ids = get_all_user_ids()
         
-        notification_count = 0
-        for user in all_users:
-            try:
-                create_safety_check_notification(
-                    user_id=user.id,
-                    vehicle_plate=last_check.vehicle_plate_number or 'غير محدد',
-                    supervisor_name=last_check.driver_name or 'غير محدد',
-                    check_status=last_check.approval_status or 'pending',
-                    check_id=last_check.id
-                )
-                notification_count += 1
-            except Exception as e:
-                current_app.logger.error(f'خطأ في إنشاء إشعار للمستخدم {user.id}: {str(e)}')
+        notification_count = notify_users(user_ids, **safety_check_notification_fields(
+            vehicle_plate=last_check.vehicle_plate_number or 'غير محدد',
+            supervisor_name=last_check.driver_name or 'غير محدد',
+            check_status=last_check.approval_status or 'pending',
+            check_id=last_check.id
+        ))
+        db.session.commit()
         
         return jsonify({
             'success': True,
             'message': f'تم إنشاء {notification_count} إشعار لفحص السلامة {last_check.id}',
             'check_id': last_check.id,
-            'users_count': len(all_users)
+            'users_count': len(user_ids)
         })
     except Exception as e:
         current_app.logger.error(f'خطأ في اختبار الإشعارات: {str(e)}')
@@ -307,30 +310,6 @@ def get_all_current_drivers():
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-def compress_image(image_path, max_size=1200, quality=85):
-    """ضغط الصورة لتقليل حجمها مع دعم HEIC من الآيفون"""
-    try:
-        with Image.open(image_path) as img:
-            # تحويل RGBA أو أي تنسيق آخر إلى RGB
-            if img.mode in ('RGBA', 'LA', 'P'):
-                img = img.convert('RGB')
-            
-            # تحويل HEIC إلى RGB وضغطها
-            if img.mode != 'RGB':
-                img = img.convert('RGB')
-            
-            # تغيير حجم الصورة إذا كانت أكبر من الحد المسموح
-            if img.width > max_size or img.height > max_size:
-                img.thumbnail((max_size, max_size), Image.Resampling.LANCZOS)
-            
-            # حفظ الصورة المضغوطة
-            img.save(image_path, 'JPEG', quality=quality, optimize=True)
-            return True
-    except Exception as e:
-        current_app.logger.error(f"خطأ في ضغط الصورة: {str(e)}")
-        return False
-
-
 def send_supervisor_notification_email(safety_check):
     """
     تقوم ببناء وإرسال بريد إلكتروني لإشعار المشرف بوجود طلب فحص جديد.
@@ -567,28 +546,9 @@ def handle_safety_check_submission(vehicle):
                         ext = secure_filename(file.filename).rsplit('.', 1)[1].lower() if '.' in file.filename else 'jpg'
                         filename = f"{uuid.uuid4()}.{ext}"
                         
-                        # قراءة بيانات الملف
-                        file_data = file.read()
-                        file.seek(0)  # إعادة المؤشر للبداية
-                        
-                        # حفظ مؤقتاً للضغط في مجلد آمن بدلاً من /tmp
-                        temp_dir = os.path.join(current_app.static_folder, '.temp')
-                        os.makedirs(temp_dir, exist_ok=True)
-                        temp_path = os.path.join(temp_dir, filename)
-                        with open(temp_path, 'wb') as f:
-                            f.write(file_data)
-                        
-                        # ضغط الصورة
-                        compress_image(temp_path)
-                        
-                        # قراءة الصورة المضغوطة
-                        with open(temp_path, 'rb') as f:
-                            compressed_data = f.read()
-                        
-                        # رفع إلى Object Storage
-                        object_key = upload_image(compressed_data, 'safety_checks', filename)
-                        
-                        # 💾 الملف المؤقت يبقى محفوظاً في static/.temp/ بشكل دائم
+                        # حفظ الملف ثم ضغطه وإنشاء النسخ المصغرة في الخلفية
+                        object_key = upload_image(file, 'safety_checks', filename)
+                        submit_image(object_key, max_size=1200, to_jpeg=True)
                         
                         # حفظ في قاعدة البيانات
                         safety_image = VehicleSafetyImage()
@@ -636,29 +596,10 @@ def handle_safety_check_submission(vehicle):
                         # إنشاء اسم ملف آمن
                         filename = f"{uuid.uuid4()}.{ext}"
                         
-                        # حفظ مؤقتاً في مجلد آمن بدلاً من /tmp
-                        temp_dir = os.path.join(current_app.static_folder, '.temp')
-                        os.makedirs(temp_dir, exist_ok=True)
-                        temp_path = os.path.join(temp_dir, filename)
-                        
-                        with open(temp_path, 'wb') as f:
-                            f.write(image_bytes)
-                        
-                        # ضغط الصورة
-                        success = compress_image(temp_path)
-                        if not success:
-                            current_app.logger.warning(f"فشل ضغط الصورة {filename}")
-                        else:
-                            current_app.logger.info(f"تم تحويل صورة {source_format} إلى JPEG: {filename}")
-                        
-                        # قراءة الصورة المضغوطة
-                        with open(temp_path, 'rb') as f:
-                            compressed_data = f.read()
-                        
-                        # رفع إلى Object Storage
-                        object_key = upload_image(compressed_data, 'safety_checks', filename)
-                        
-                        # 💾 الملف المؤقت يبقى محفوظاً في static/.temp/ بشكل دائم
+                        # حفظ الصورة ثم تحويلها إلى JPEG وضغطها في الخلفية
+                        object_key = upload_image(image_bytes, 'safety_checks', filename)
+                        submit_image(object_key, max_size=1200, to_jpeg=True)
+                        current_app.logger.info(f"تمت جدولة تحويل صورة {source_format} إلى JPEG: {filename}")
                         
                         # حفظ معلومات الصورة في قاعدة البيانات
                         description = notes_list[i] if i < len(notes_list) else None
@@ -679,24 +620,17 @@ def handle_safety_check_submission(vehicle):
         
         # إنشاء إشعارات للمسؤولين عند إنشاء فحص جديد
         try:
-            # الحصول على جميع المستخدمين (الموديل مستورد في أعلى الملف)
-            all_users = User.query.all()
-            current_app.logger.info(f"Found {len(all_users)} users for safety check notifications")
-            
-            for user in all_users:
-                try:
-                    # استخدام الدالة المحلية create_safety_check_notification
-                    create_safety_check_notification(
-                        user_id=user.id,
-                        vehicle_plate=safety_check.vehicle_plate_number,
-                        supervisor_name=safety_check.driver_name,
-                        check_status='pending',
-                        check_id=safety_check.id
-                    )
-                    current_app.logger.info(f"Created safety check notification for user {user.id}")
-                except Exception as e:
-                    current_app.logger.error(f'خطأ في إنشاء إشعار للمستخدم {user.id}: {str(e)}')
+            # إشعار لكل المستخدمين بعبارة INSERT واحدة
+            count = notify_all_users(**safety_check_notification_fields(
+                vehicle_plate=safety_check.vehicle_plate_number,
+                supervisor_name=safety_check.driver_name,
+                check_status='pending',
+                check_id=safety_check.id
+            ))
+            db.session.commit()
+            current_app.logger.info(f"Created {count} safety check notifications")
         except Exception as e:
+            db.session.rollback()
             current_app.logger.error(f'خطأ في إنشاء إشعارات فحص السلامة: {str(e)}')
 
         # رفع تلقائي إلى Google Drive
@@ -2447,23 +2381,9 @@ def admin_create_check_from_images():
                 file_ext = original_filename.rsplit('.', 1)[1].lower()
                 unique_filename = f"safety_check_{safety_check.id}_{uuid.uuid4().hex}.{file_ext}"
                 
-                # حفظ مؤقتاً للضغط في مجلد آمن بدلاً من /tmp
-                temp_dir = os.path.join(current_app.static_folder, '.temp')
-                os.makedirs(temp_dir, exist_ok=True)
-                temp_path = os.path.join(temp_dir, unique_filename)
-                image_file.save(temp_path)
-                
-                # ضغط الصورة
-                compress_image(temp_path)
-                
-                # قراءة الصورة المضغوطة
-                with open(temp_path, 'rb') as f:
-                    compressed_data = f.read()
-                
-                # رفع إلى Object Storage
-                object_key = upload_image(compressed_data, 'safety_checks', unique_filename)
-                
-                # 💾 الملف المؤقت يبقى محفوظاً في static/.temp/ بشكل دائم
+                # حفظ الصورة ثم ضغطها وإنشاء النسخ المصغرة في الخلفية
+                object_key = upload_image(image_file, 'safety_checks', unique_filename)
+                submit_image(object_key, max_size=1200, to_jpeg=True)
                 
                 # إنشاء سجل الصورة
                 image_record = VehicleSafetyImage()
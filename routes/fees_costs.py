@@ -1,6 +1,7 @@
 from datetime import datetime, timedelta
 import os
-import xlsxwriter
+from utils.lazy_imports import lazy_import
+xlsxwriter = lazy_import('xlsxwriter')
 from io import BytesIO
 from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, send_file
 from flask_login import login_required, current_user
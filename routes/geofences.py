@@ -6,8 +6,6 @@ from utils.geofence_session_manager import SessionManager
 from sqlalchemy import func, desc
 import re
 import requests
-from openpyxl import Workbook
-from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
 from io import BytesIO
 
 geofences_bp = Blueprint('geofences', __name__, url_prefix='/employees/geofences')
@@ -726,6 +724,8 @@ def auto_record_attendance(geofence_id):
 @login_required
 def export_entry_data(geofence_id):
     """تصدير بيانات دخول الدائرة"""
+    from openpyxl import Workbook
+    from openpyxl.styles import Font, PatternFill
     try:
         geofence = Geofence.query.get_or_404(geofence_id)
         
@@ -774,6 +774,8 @@ def export_entry_data(geofence_id):
 @login_required
 def export_daily_attendance(geofence_id):
     """تصدير حضور اليوم"""
+    from openpyxl import Workbook
+    from openpyxl.styles import Font, PatternFill
     try:
         geofence = Geofence.query.get_or_404(geofence_id)
         today_start = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
@@ -835,6 +837,8 @@ def export_daily_attendance(geofence_id):
 @login_required
 def export_entry_timeline(geofence_id):
     """تصدير الموظفين الذين دخلوا اليوم بحسب الوقت"""
+    from openpyxl import Workbook
+    from openpyxl.styles import Font, PatternFill
     try:
         geofence = Geofence.query.get_or_404(geofence_id)
         today_start = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
@@ -1277,6 +1281,8 @@ def export_events(geofence_id):
 @login_required
 def export_attendance(geofence_id):
     """تصدير سجلات الحضور إلى Excel بنفس تنسيق export_events"""
+    from openpyxl import Workbook
+    from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
     geofence = Geofence.query.get_or_404(geofence_id)
     
     export_date_str = request.args.get('date')
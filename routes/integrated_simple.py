@@ -16,7 +16,6 @@ from models_accounting import Transaction, Account, FiscalYear
 import os
 import json
 from flask import current_app
-from openai import OpenAI
 
 integrated_bp = Blueprint('integrated', __name__)
 
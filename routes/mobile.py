@@ -5,12 +5,13 @@
 
 import os
 import json
+import time
 import uuid
 from datetime import datetime, timedelta, date
 from sqlalchemy import extract, func, cast, Date
 from sqlalchemy.orm import joinedload
 from sqlalchemy.orm import joinedload
-from flask import Blueprint, render_template, redirect, url_for, request, flash, jsonify, session, current_app, send_file
+from flask import Blueprint, render_template, redirect, url_for, request, flash, jsonify, session, current_app, send_file, Response, stream_with_context
 
 from flask_login import login_user, logout_user, login_required, current_user
 from werkzeug.security import check_password_hash
@@ -20,6 +21,7 @@ from wtforms import StringField, PasswordField, BooleanField, SubmitField, Selec
 from wtforms.validators import DataRequired, Email, Length, ValidationError, Optional
 from markupsafe import Markup
 import base64
+import io
 from models import VehicleProject, VehicleWorkshop, VehicleWorkshopImage, db, User, Employee, Department, Document, Vehicle, Attendance, Salary, FeesCost as Fee, VehicleChecklist, VehicleChecklistItem, VehicleMaintenance, VehicleMaintenanceImage, VehicleFuelConsumption, UserPermission, Module, Permission, SystemAudit, UserRole, VehiclePeriodicInspection, VehicleSafetyCheck, VehicleHandover, VehicleHandoverImage, VehicleChecklistImage, VehicleDamageMarker, ExternalAuthorization, Project, OperationRequest, OperationNotification,VehicleAccident,VehicleRental, Nationality, MobileDevice
 # from app import app
 from flask import current_app
@@ -28,6 +30,10 @@ from routes.vehicles import update_vehicle_state, update_vehicle_driver
 from utils.hijri_converter import convert_gregorian_to_hijri, format_hijri_date
 from utils.decorators import module_access_required, permission_required
 from utils.audit_logger import log_activity
+from utils.image_pipeline import submit_image
+from services.blob_store import BlobStore
+from services.upload_sessions import claim_uploads
+from services import live_locations, tracking_snapshot
 from routes.operations import create_operation_request
 
 # from flask import render_template, request, redirect, url_for, flash
@@ -58,6 +64,9 @@ from routes.operations import create_operation_request # تأكد من المس
 # إنشاء مخطط المسارات
 mobile_bp = Blueprint('mobile', __name__)
 
+# أقصى مدة لاتصال بث المواقع قبل أن يعيد المتصفح الاتصال بآخر مؤشر
+LIVE_STREAM_MAX_AGE = 300
+
 # نموذج تسجيل الدخول
 class LoginForm(FlaskForm):
     username = StringField('اسم المستخدم', validators=[DataRequired('اسم المستخدم مطلوب')])
@@ -230,7 +239,7 @@ def root():
 def index():
     """الصفحة الرئيسية للنسخة المحمولة"""
     # التحقق من صلاحيات المستخدم للوصول إلى لوحة التحكم
-    from models import Module, UserRole, EmployeeLocation
+    from models import Module, UserRole
     import json
 
     # إذا كان المستخدم لا يملك صلاحيات لرؤية لوحة التحكم، توجيهه إلى أول وحدة مصرح له بالوصول إليها
@@ -285,38 +294,8 @@ def index():
     # جلب جميع الأقسام
     departments = Department.query.all()
     
-    # بناء employee_locations مع حالة الاتصال
-    employee_locations = {}
-    
-    for emp in all_employees:
-        location = EmployeeLocation.query.filter_by(employee_id=emp.id).order_by(EmployeeLocation.recorded_at.desc()).first()
-        if location and location.latitude is not None and location.longitude is not None:
-            try:
-                age_minutes = (datetime.utcnow() - location.recorded_at).total_seconds() / 60
-                
-                # تحديد الحالة
-                if age_minutes < 5:
-                    status = 'active'
-                elif age_minutes < 30:
-                    status = 'recently_active'
-                elif age_minutes < 360:
-                    status = 'inactive'
-                else:
-                    status = 'not_registered'
-                
-                employee_locations[str(emp.id)] = {
-                    'latitude': float(location.latitude),
-                    'longitude': float(location.longitude),
-                    'name': emp.name,
-                    'employee_id': emp.employee_id,
-                    'status': status,
-                    'age_minutes': int(age_minutes)
-                }
-            except Exception as e:
-                print(f"Error processing location for employee {emp.id}: {e}")
-                employee_locations[str(emp.id)] = {'status': 'error'}
-        else:
-            employee_locations[str(emp.id)] = {'status': 'not_registered'}
+    # حالة اتصال كل موظف من لقطة التتبع المشتركة
+    employee_locations = tracking_snapshot.map_locations()
     
     # جلب الدوائر الجغرافية
     geofences = Geofence.query.all()
@@ -361,188 +340,23 @@ def index():
 @login_required
 def mobile_tracking():
     """صفحة تتبع الموظفين المباشر للموبايل - مماثلة لصفحة الكمبيوتر"""
-    from math import radians, sin, cos, sqrt, atan2
-    from models import Geofence, EmployeeLocation
-    from sqlalchemy import func as sql_func, and_
-    
-    cutoff_time_active = datetime.utcnow() - timedelta(hours=1)
-    cutoff_time_location = datetime.utcnow() - timedelta(hours=24)
-    
-    all_employees = Employee.query.options(db.joinedload(Employee.departments)).all()
-    employee_ids = [emp.id for emp in all_employees]
-    
-    latest_locations_subq = db.session.query(
-        EmployeeLocation.employee_id,
-        EmployeeLocation.id.label('location_id'),
-        sql_func.row_number().over(
-            partition_by=EmployeeLocation.employee_id,
-            order_by=EmployeeLocation.recorded_at.desc()
-        ).label('rn')
-    ).filter(
-        EmployeeLocation.employee_id.in_(employee_ids)
-    ).subquery()
-    
-    latest_locations_query = db.session.query(
-        EmployeeLocation
-    ).join(
-        latest_locations_subq,
-        and_(
-            EmployeeLocation.id == latest_locations_subq.c.location_id,
-            latest_locations_subq.c.rn == 1
-        )
-    ).all()
-    
-    locations_by_employee = {loc.employee_id: loc for loc in latest_locations_query}
-    
-    active_employees = []
-    inactive_employees = []
-    employees_with_vehicles = []
-    
-    for emp in all_employees:
-        latest_location = locations_by_employee.get(emp.id)
-        
-        if latest_location and latest_location.recorded_at >= cutoff_time_active:
-            active_employees.append({
-                'employee': emp,
-                'location': latest_location,
-                'departments': [d.name for d in emp.departments]
-            })
-            
-            if latest_location.vehicle_id:
-                employees_with_vehicles.append({
-                    'employee': emp,
-                    'location': latest_location,
-                    'vehicle': latest_location.vehicle
-                })
-        else:
-            inactive_employees.append(emp)
-    
-    all_geofences = Geofence.query.filter_by(is_active=True).all()
-    
-    employees_inside_geofences = []
-    employees_outside_geofences = []
-    geofence_stats = []
-    employees_inside_any_geofence = set()
-    
-    for geofence in all_geofences:
-        inside_count = 0
-        inside_employees = []
-        
-        for emp in all_employees:
-            latest_location = locations_by_employee.get(emp.id)
-            
-            if latest_location and latest_location.recorded_at >= cutoff_time_location:
-                lat1, lon1 = float(latest_location.latitude), float(latest_location.longitude)
-                lat2, lon2 = float(geofence.center_latitude), float(geofence.center_longitude)
-                
-                R = 6371000
-                dlat = radians(lat2 - lat1)
-                dlon = radians(lon2 - lon1)
-                a = sin(dlat/2)**2 + cos(radians(lat1)) * cos(radians(lat2)) * sin(dlon/2)**2
-                c = 2 * atan2(sqrt(a), sqrt(1-a))
-                distance = R * c
-                
-                if distance <= geofence.radius_meters:
-                    inside_count += 1
-                    inside_employees.append({
-                        'employee': emp,
-                        'location': latest_location,
-                        'distance': distance
-                    })
-                    employees_inside_any_geofence.add(emp.id)
-        
-        geofence_stats.append({
-            'geofence': geofence,
-            'employees': inside_employees,
-            'count': inside_count
-        })
-    
-    for emp_data in active_employees:
-        emp = emp_data['employee']
-        if emp.id not in employees_inside_any_geofence:
-            employees_outside_geofences.append({
-                'employee': emp,
-                'location': emp_data['location']
-            })
-    
-    for emp_data in active_employees:
-        emp = emp_data['employee']
-        for geofence in all_geofences:
-            latest_location = locations_by_employee.get(emp.id)
-            if latest_location:
-                lat1, lon1 = float(latest_location.latitude), float(latest_location.longitude)
-                lat2, lon2 = float(geofence.center_latitude), float(geofence.center_longitude)
-                
-                R = 6371000
-                dlat = radians(lat2 - lat1)
-                dlon = radians(lon2 - lon1)
-                a = sin(dlat/2)**2 + cos(radians(lat1)) * cos(radians(lat2)) * sin(dlon/2)**2
-                c = 2 * atan2(sqrt(a), sqrt(1-a))
-                distance = R * c
-                
-                if distance <= geofence.radius_meters:
-                    emp_data['geofence'] = geofence
-                    break
-        
-        if latest_location and latest_location.vehicle_id and latest_location.vehicle:
-            emp_data['vehicle'] = latest_location.vehicle
-    
-    stats = {
-        'total_employees': len(all_employees),
-        'active_employees': len(active_employees),
-        'inactive_employees': len(inactive_employees),
-        'inside_geofences_count': len(employees_inside_any_geofence),
-        'outside_geofences_count': len(employees_outside_geofences),
-        'on_vehicles_count': len(employees_with_vehicles)
-    }
-    
-    employee_locations = {}
-    for emp in all_employees:
-        location = locations_by_employee.get(emp.id)
-        if location and location.latitude is not None and location.longitude is not None:
-            try:
-                age_minutes = (datetime.utcnow() - location.recorded_at).total_seconds() / 60
-                if age_minutes < 5:
-                    status = 'active'
-                elif age_minutes < 30:
-                    status = 'recently_active'
-                elif age_minutes < 360:
-                    status = 'inactive'
-                else:
-                    status = 'not_registered'
-                
-                employee_locations[str(emp.id)] = {
-                    'latitude': float(location.latitude),
-                    'longitude': float(location.longitude),
-                    'name': emp.name,
-                    'employee_id': emp.employee_id,
-                    'status': status,
-                    'age_minutes': int(age_minutes),
-                    'photo_url': emp.profile_image
-                }
-            except:
-                employee_locations[str(emp.id)] = {'status': 'not_registered'}
-        else:
-            employee_locations[str(emp.id)] = {'status': 'not_registered'}
-    
+    snapshot = tracking_snapshot.current()
+    data = tracking_snapshot.overview(snapshot)
+
     geofences_data = [{
         'id': gf.id,
         'name': gf.name,
-        'center_latitude': float(gf.center_latitude),
-        'center_longitude': float(gf.center_longitude),
+        'center_latitude': gf.center_latitude,
+        'center_longitude': gf.center_longitude,
         'radius_meters': gf.radius_meters,
         'color': gf.color
-    } for gf in all_geofences]
-    
+    } for gf in snapshot.geofences]
+
     return render_template('mobile/tracking.html',
-                          stats=stats,
-                          employees_active=active_employees,
-                          employees_inactive=inactive_employees,
-                          employees_by_geofence=geofence_stats,
-                          employees_outside_geofences=employees_outside_geofences,
-                          employee_locations_json=json.dumps(employee_locations),
+                          employee_locations_json=json.dumps(tracking_snapshot.map_locations(snapshot)),
                           geofences_json=json.dumps(geofences_data),
-                          now=datetime.utcnow())
+                          now=datetime.utcnow(),
+                          **data)
 
 
 # صفحة تفاصيل الدائرة الجغرافية
@@ -747,64 +561,79 @@ def geofence_details(geofence_id):
 @mobile_bp.route('/api/live-locations')
 @login_required
 def get_live_locations():
-    """جلب مواقع الموظفين الحية مباشرة من قاعدة البيانات"""
-    from models import Geofence, EmployeeLocation
-    
-    all_employees = Employee.query.all()
-    employee_locations = {}
-    
-    for emp in all_employees:
-        location = EmployeeLocation.query.filter_by(employee_id=emp.id).order_by(EmployeeLocation.recorded_at.desc()).first()
-        if location and location.latitude is not None and location.longitude is not None:
-            try:
-                age_minutes = (datetime.utcnow() - location.recorded_at).total_seconds() / 60
-                
-                # تحديد الحالة بناءً على عمر الموقع
-                if age_minutes < 5:
-                    status = 'active'
-                elif age_minutes < 30:
-                    status = 'recently_active'
-                elif age_minutes < 360:
-                    status = 'inactive'
-                else:
-                    status = 'not_registered'
-                
-                employee_locations[str(emp.id)] = {
-                    'latitude': float(location.latitude),
-                    'longitude': float(location.longitude),
-                    'name': emp.name,
-                    'employee_id': emp.employee_id,
-                    'status': status,
-                    'age_minutes': int(age_minutes),
-                    'last_update': location.recorded_at.strftime('%Y-%m-%d %H:%M:%S'),
-                    'photo_url': emp.profile_image,
-                    'department_name': emp.department.name if emp.department else 'غير محدد',
-                    'department_id': emp.departments[0].id if emp.departments else None
-                }
-            except Exception as e:
-                print(f"Error processing location for employee {emp.id}: {e}")
-                employee_locations[str(emp.id)] = {'status': 'error'}
-        else:
-            employee_locations[str(emp.id)] = {'status': 'not_registered'}
-    
-    # جلب الدوائر الجغرافية
-    geofences = Geofence.query.all()
-    geofences_data = [{
-        'id': gf.id,
-        'name': gf.name,
-        'latitude': float(gf.center_latitude),
-        'longitude': float(gf.center_longitude),
-        'radius': gf.radius_meters,
-        'color': gf.color,
-        'department_id': gf.department_id
-    } for gf in geofences]
+    """
+    جلب مواقع الموظفين الحية من الذاكرة (services.live_locations)
+
+    بدون cursor: كل الموظفين مع الدوائر الجغرافية. مع cursor من الرد السابق: من تحرّك
+    أو تغيّرت حالته فقط، ورقم إصدار الدوائر (تُجلب من /api/live-locations/geofences عند تغيّره).
+    """
+    locations, cursor, full = live_locations.feed(request.args.get('cursor'))
+    geofences_data, geofences_version = live_locations.geofences()
     
-    return jsonify({
+    payload = {
         'success': True,
-        'locations': employee_locations,
-        'geofences': geofences_data,
+        'full': full,
+        'locations': locations,
+        'cursor': cursor,
+        'geofences_version': geofences_version,
         'timestamp': datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
-    })
+    }
+    if full:
+        payload['geofences'] = geofences_data
+    return jsonify(payload)
+
+
+@mobile_bp.route('/api/live-locations/geofences')
+@login_required
+def get_live_geofences():
+    """الدوائر الجغرافية للخريطة مع ETag (304 إذا لم تتغير)"""
+    geofences_data, geofences_version = live_locations.geofences()
+    response = jsonify({'success': True, 'geofences': geofences_data, 'version': geofences_version})
+    response.set_etag(geofences_version)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+
+@mobile_bp.route('/api/live-locations/stream')
+@login_required
+def stream_live_locations():
+    """
+    بث تغييرات المواقع عبر Server-Sent Events (الحدث locations بنفس شكل رد الاستطلاع بالمؤشر)
+
+    كل اتصال مفتوح يشغل عاملاً، لذا البث معطل افتراضياً ويُفعَّل بالإعداد
+    LIVE_LOCATIONS_STREAM_ENABLED مع عمال gevent أو gthread.
+    """
+    if not current_app.config.get('LIVE_LOCATIONS_STREAM_ENABLED'):
+        return jsonify({'success': False, 'error': 'البث غير مفعل، استخدم /mobile/api/live-locations'}), 503
+
+    cursor = request.headers.get('Last-Event-ID') or request.args.get('cursor')
+    db.session.close()
+
+    def events():
+        nonlocal cursor
+        yield "retry: 5000\n\n"
+        started = time.monotonic()
+        while time.monotonic() - started < LIVE_STREAM_MAX_AGE:
+            try:
+                locations, cursor, full = live_locations.feed(cursor)
+                _, geofences_version = live_locations.geofences()
+            finally:
+                db.session.close()
+            if locations or full:
+                payload = json.dumps({'full': full, 'locations': locations, 'cursor': cursor,
+                                      'geofences_version': geofences_version}, ensure_ascii=False)
+                yield f"id: {cursor}\nevent: locations\ndata: {payload}\n\n"
+            else:
+                yield ": ping\n\n"
+            # يستيقظ فوراً عند حفظ موقع في نفس العملية، وإلا عند موعد المزامنة التالي
+            live_locations.wait_for_change(live_locations.SYNC_INTERVAL)
+
+    response = Response(stream_with_context(events()), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    # منع nginx من تجميع البث في ذاكرته
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
 
 
 # صفحة تسجيل الدخول - النسخة المحمولة
@@ -3017,30 +2846,22 @@ def upload_vehicle_document(vehicle_id):
     if file and allowed_file(file.filename):
         from werkzeug.utils import secure_filename
         
-        # إنشاء اسم ملف فريد
-        filename = secure_filename(file.filename)
-        unique_filename = f"{uuid.uuid4()}_{filename}"
-        
-        # إنشاء المسار المناسب حسب نوع الوثيقة
+        # تحديد الحقل المناسب حسب نوع الوثيقة
         if document_type == 'registration_form':
-            upload_folder = 'static/uploads/vehicles/registration_forms'
             field_name = 'registration_form_image'
         elif document_type == 'plate':
-            upload_folder = 'static/uploads/vehicles/plates'
             field_name = 'plate_image'
         elif document_type == 'insurance':
-            upload_folder = 'static/uploads/vehicles/insurance'
             field_name = 'insurance_file'
         else:
             flash('نوع الوثيقة غير صحيح', 'error')
             return redirect(url_for('mobile.vehicle_details', vehicle_id=vehicle_id))
         
-        # إنشاء المجلد إذا لم يكن موجوداً
-        os.makedirs(upload_folder, exist_ok=True)
-        
-        # حفظ الملف
-        file_path = os.path.join(upload_folder, unique_filename)
-        file.save(file_path)
+        # حفظ الملف في مخزن الملفات (نفس الملف لا يُكرر)
+        file_path, _ = BlobStore.save(file, secure_filename(file.filename))
+        if not file_path:
+            flash('الملف فارغ', 'error')
+            return redirect(url_for('mobile.vehicle_details', vehicle_id=vehicle_id))
         
         # تحديث قاعدة البيانات
         setattr(vehicle, field_name, file_path)
@@ -3445,37 +3266,29 @@ def save_base64_image(base64_string, subfolder):
 
 def save_uploaded_file(file, subfolder):
     """
-    تحفظ ملف مرفوع (من request.files) في مجلد فرعي داخل uploads،
+    تحفظ ملف مرفوع (من request.files) في مخزن الملفات،
     وتُرجع المسار النسبي الكامل.
     """
     if not file or not file.filename:
         return None
 
     try:
-        # إعداد مسار الحفظ
-        upload_folder = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'static', 'uploads', subfolder)
-        os.makedirs(upload_folder, exist_ok=True)
-
-        # الحصول على اسم آمن للملف وإنشاء اسم فريد
         from werkzeug.utils import secure_filename
-        filename_secure = secure_filename(file.filename)
-        # فصل الاسم والامتداد
-        name, ext = os.path.splitext(filename_secure)
-        # إنشاء اسم فريد لمنع الكتابة فوق الملفات
-        unique_filename = f"{name}_{uuid.uuid4().hex[:8]}{ext}"
-
-        file_path = os.path.join(upload_folder, unique_filename)
-        file.save(file_path)
+        relative_path, _ = BlobStore.save(file, secure_filename(file.filename))
 
         # إرجاع المسار النسبي الكامل (متطابق مع save_file)
-        return f"static/uploads/{subfolder}/{unique_filename}"
+        return relative_path
 
     except Exception as e:
         print(f"Error saving uploaded file: {e}")
         return None
 
 def save_file(file, folder):
-    """حفظ الملف (صورة أو PDF) في المجلد المحدد وإرجاع المسار ونوع الملف - مع دعم HEIC"""
+    """حفظ الملف (صورة أو PDF) في مخزن الملفات وإرجاع المسار ونوع الملف - مع دعم HEIC
+
+    الملفات تُخزن حسب بصمة محتواها (services/blob_store.py)، لذلك رفع نفس الصورة
+    مرة أخرى يعيد نفس المسار بدلاً من نسخة جديدة. المعامل folder محفوظ للتوافق.
+    """
     if not file:
         current_app.logger.warning("save_file: No file provided")
         return None, None
@@ -3485,61 +3298,42 @@ def save_file(file, folder):
 
     # فصل الاسم والامتداد قبل استخدام secure_filename لتجنب فقدان الامتداد
     original_filename = file.filename
-    name_part, ext_part = os.path.splitext(original_filename)
-    
-    # استخدام secure_filename على الاسم فقط (بدون الامتداد)
-    safe_name = secure_filename(name_part) or 'file'
-    
-    # إنشاء اسم فريد مع الامتداد الأصلي
-    unique_filename = f"{uuid.uuid4()}_{safe_name}{ext_part}"
-
-    # التأكد من وجود المجلد
-    upload_folder = os.path.join(current_app.static_folder, 'uploads', folder)
-    os.makedirs(upload_folder, exist_ok=True)
-
-    # حفظ الملف
-    file_path = os.path.join(upload_folder, unique_filename)
-    final_file_path = file_path
+    ext_lower = os.path.splitext(original_filename)[1].lower()
     
     try:
-        current_app.logger.info(f"save_file: Saving {original_filename} to {file_path}")
-        file.save(file_path)
+        current_app.logger.info(f"save_file: Saving {original_filename} to blob store")
+        # الصور تُصغّر قبل حساب البصمة وتُنشأ نسخها المصغرة في الخلفية (للملف الجديد فقط)؛
+        # أصل HEIC يُحفظ كما هو لأن المعالجة تتم على نسخة JPEG المحولة أدناه
+        if ext_lower in ('.heic', '.heif'):
+            relative_path, created = BlobStore.save(file, f"file{ext_lower}")
+        else:
+            relative_path, created = BlobStore.save_image(file, f"file{ext_lower}")
         
         # ✅ التحقق من نجاح الحفظ
-        if not os.path.exists(file_path):
-            current_app.logger.error(f"save_file: File NOT saved! Path: {file_path}")
+        if not relative_path:
+            current_app.logger.error(f"save_file: Empty file: {original_filename}")
             return None, None
         
-        file_size = os.path.getsize(file_path)
-        current_app.logger.info(f"save_file: File saved successfully! Size: {file_size} bytes")
-        
         # تحويل HEIC/HEIF إلى JPEG للتوافق مع المتصفحات
-        ext_lower = ext_part.lower()
+        # 💾 الملف الأصلي يبقى محفوظاً في المخزن - لا حذف للملفات
         if ext_lower in ('.heic', '.heif'):
             try:
-                from PIL import Image
-                current_app.logger.info(f"save_file: Converting HEIC to JPEG: {file_path}")
-                img = Image.open(file_path)
-                if img.mode != 'RGB':
-                    img = img.convert('RGB')
-                jpeg_filename = unique_filename.rsplit('.', 1)[0] + '.jpg'
-                jpeg_path = os.path.join(upload_folder, jpeg_filename)
-                img.save(jpeg_path, 'JPEG', quality=90)
-                # 💾 الملف الأصلي يبقى محفوظاً - لا حذف للملفات
-                unique_filename = jpeg_filename
-                final_file_path = jpeg_path
-                current_app.logger.info(f"save_file: HEIC conversion successful: {jpeg_path}")
+                from PIL import Image, ImageOps
+                current_app.logger.info(f"save_file: Converting HEIC to JPEG: {relative_path}")
+                with Image.open(BlobStore.local_path(relative_path)) as heic_img:
+                    img = ImageOps.exif_transpose(heic_img)
+                    if img.mode != 'RGB':
+                        img = img.convert('RGB')
+                    buffer = io.BytesIO()
+                    img.save(buffer, 'JPEG', quality=90)
+                buffer.seek(0)
+                relative_path, created = BlobStore.save_image(buffer, 'file.jpg')
+                current_app.logger.info(f"save_file: HEIC conversion successful: {relative_path}")
             except Exception as convert_error:
                 current_app.logger.error(f"save_file: HEIC conversion failed: {convert_error}")
         
-        # التحقق النهائي من وجود الملف
-        if not os.path.exists(final_file_path):
-            current_app.logger.error(f"save_file: Final file NOT found! Path: {final_file_path}")
-            return None, None
-        
         # تحديد نوع الملف
         file_type = 'pdf' if ext_lower == '.pdf' else 'image'
-        relative_path = f"static/uploads/{folder}/{unique_filename}"
         current_app.logger.info(f"save_file: SUCCESS! Returning path: {relative_path}")
         return relative_path, file_type
         
@@ -3829,6 +3623,15 @@ def create_handover_mobile(vehicle_id):
                         )
                         db.session.add(attachment)
 
+            # المرفقات المرفوعة مسبقاً على دفعات (/mobile/uploads)
+            for uploaded in claim_uploads(request.form.getlist('upload_ids'), current_user.id):
+                desc = request.form.get(f"description_{uploaded['filename']}", '')
+                attachment = VehicleHandoverImage(
+                    handover_record_id=handover.id, file_path=uploaded['path'], file_type=uploaded['file_type'],
+                    image_path=uploaded['path'], file_description=desc, image_description=desc
+                )
+                db.session.add(attachment)
+
             db.session.commit()
 
             log_activity('create', 'vehicle_handover', handover.id, f"إنشاء طلب {action_type} للمركبة {vehicle.plate_number} عبر الجوال (بانتظار الموافقة)")
@@ -3983,6 +3786,18 @@ def edit_handover_mobile(handover_id):
                         logging.error(f"خطأ في حفظ الملف {file.filename}: {str(e)}")
                         flash(f'خطأ في حفظ الملف {file.filename}', 'warning')
 
+            # المرفقات المرفوعة مسبقاً على دفعات (/mobile/uploads)
+            for uploaded in claim_uploads(request.form.getlist('upload_ids'), current_user.id):
+                file_description = request.form.get(f"description_{uploaded['filename']}", '')
+                db.session.add(VehicleHandoverImage(
+                    handover_record_id=existing_handover.id,
+                    image_path=uploaded['path'],
+                    image_description=file_description,
+                    file_path=uploaded['path'],
+                    file_type=uploaded['file_type'],
+                    file_description=file_description
+                ))
+
             db.session.commit()
             log_activity('update', 'vehicle_handover', existing_handover.id, f"تعديل نموذج {existing_handover.handover_type} للمركبة {vehicle.plate_number} عبر الجوال")
 
@@ -5227,23 +5042,17 @@ def add_vehicle_checklist():
 
             # معالجة الصور المرفقة إذا وجدت
             if request.files and 'images' in request.files:
-                # إنشاء مجلد لتخزين الصور إذا لم يكن موجودًا
-                vehicle_images_dir = os.path.join(app.static_folder, 'uploads', 'vehicles', 'checklists')
-                os.makedirs(vehicle_images_dir, exist_ok=True)
-
                 # الحصول على الصور من الطلب
                 images = request.files.getlist('images')
 
                 for i, image in enumerate(images):
                     if image and image.filename:
-                        # حفظ الصورة بإسم فريد في المجلد المناسب
-                        filename = secure_filename(image.filename)
-                        unique_filename = f"{datetime.now().strftime('%Y%m%d%H%M%S')}_{uuid.uuid4().hex}_{filename}"
-                        image_path = os.path.join('uploads', 'vehicles', 'checklists', unique_filename)
-                        full_path = os.path.join(app.static_folder, image_path)
-
-                        # حفظ الصورة
-                        image.save(full_path)
+                        # حفظ الصورة في مخزن الملفات (كتابة مباشرة على دفعات)
+                        saved_path, _ = save_file(image, 'vehicles/checklists')
+                        if not saved_path:
+                            continue
+                        # المسار نسبي لمجلد static كما في بقية صور الفحص
+                        image_path = saved_path[len('static/'):]
 
                         # الحصول على وصف الصورة (إذا وجد)
                         description_key = f'image_description_{i}'
@@ -5258,7 +5067,17 @@ def add_vehicle_checklist():
                         )
 
                         db.session.add(checklist_image)
-                        app.logger.info(f"تم حفظ صورة فحص: {full_path}")
+                        current_app.logger.info(f"تم حفظ صورة فحص: {saved_path}")
+
+            # الصور المرفوعة مسبقاً على دفعات (/mobile/uploads)
+            for uploaded in claim_uploads(request.form.getlist('upload_ids'), current_user.id):
+                db.session.add(VehicleChecklistImage(
+                    checklist_id=new_checklist.id,
+                    image_path=uploaded['path'][len('static/'):],
+                    image_type='inspection',
+                    description=request.form.get(f"description_{uploaded['filename']}",
+                                                 f"صورة فحص بتاريخ {inspection_date}")
+                ))
 
             # حفظ التغييرات في قاعدة البيانات
             db.session.commit()
@@ -5627,7 +5446,8 @@ def check_connection():
 def tracking_status(employee_id):
     """الحصول على حالة التتبع والموقع الحالي للموظف"""
     try:
-        employee = Employee.query.get(employee_id)
+        snapshot = tracking_snapshot.current()
+        employee = snapshot.employees.get(employee_id) or Employee.query.get(employee_id)
         if not employee:
             return jsonify({
                 'success': False,
@@ -5635,10 +5455,8 @@ def tracking_status(employee_id):
                 'error': 'الموظف غير موجود'
             }), 404
         
-        # جلب آخر موقع
-        latest_location = EmployeeLocation.query.filter_by(
-            employee_id=employee_id
-        ).order_by(EmployeeLocation.recorded_at.desc()).first()
+        # آخر موقع من لقطة التتبع
+        latest_location = snapshot.locations.get(employee_id)
         
         # جلب آخر جلسة جيوفنس
         from models import GeofenceSession
@@ -6531,7 +6349,6 @@ def edit_workshop_record(workshop_id):
 
             # معالجة الصور المرفوعة
             import os
-            from PIL import Image
             import uuid
 
             uploaded_images = []
@@ -6555,14 +6372,8 @@ def edit_workshop_record(workshop_id):
                                 file_path = os.path.join(upload_dir, filename)
                                 file.save(file_path)
                                 
-                                # ضغط الصورة إذا كانت كبيرة
-                                try:
-                                    with Image.open(file_path) as img:
-                                        if img.width > 1200 or img.height > 1200:
-                                            img.thumbnail((1200, 1200), Image.Resampling.LANCZOS)
-                                            img.save(file_path, optimize=True, quality=85)
-                                except Exception as e:
-                                    current_app.logger.warning(f"تعذر ضغط الصورة {filename}: {str(e)}")
+                                # ضغط الصورة وإنشاء النسخ المصغرة في الخلفية
+                                submit_image(file_path, max_size=1200)
                                 
                                 # إضافة سجل الصورة لقاعدة البيانات
                                 image_record = VehicleWorkshopImage(
@@ -6600,15 +6411,9 @@ def edit_workshop_record(workshop_id):
                             file_path = os.path.join(upload_dir, filename)
                             file.save(file_path)
                             
-                            # ضغط الصورة إذا كانت صورة وكبيرة
+                            # ضغط الصورة إذا كانت صورة وكبيرة (في الخلفية)
                             if file_ext in {'png', 'jpg', 'jpeg', 'gif'}:
-                                try:
-                                    with Image.open(file_path) as img:
-                                        if img.width > 1200 or img.height > 1200:
-                                            img.thumbnail((1200, 1200), Image.Resampling.LANCZOS)
-                                            img.save(file_path, optimize=True, quality=85)
-                                except Exception as e:
-                                    current_app.logger.warning(f"تعذر ضغط الصورة {filename}: {str(e)}")
+                                submit_image(file_path, max_size=1200)
                             
                             return f"uploads/workshop/receipts/{filename}"
                         
@@ -2,11 +2,10 @@ from datetime import datetime, timedelta
 from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, send_file
 from flask_login import login_required, current_user
 from sqlalchemy import or_, and_, func
-import pandas as pd
+from utils.lazy_imports import lazy_import
+pd = lazy_import('pandas')
 import io
 from io import BytesIO
-from openpyxl import Workbook
-from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
 from flask import make_response
 import os
 import uuid
@@ -461,6 +460,8 @@ def import_phone_numbers():
 @login_required
 def download_phone_template():
     """تحميل نموذج Excel لاستيراد أرقام الهواتف"""
+    from openpyxl import Workbook
+    from openpyxl.styles import Font, PatternFill, Alignment
     try:
         # إنشاء Workbook جديد
         wb = Workbook()
@@ -737,6 +738,8 @@ def import_excel():
 @login_required
 def export_excel():
     """تصدير الأجهزة إلى ملف Excel"""
+    from openpyxl import Workbook
+    from openpyxl.styles import Font, PatternFill, Alignment
     try:
         # جلب جميع الأجهزة
         devices = MobileDevice.query.order_by(MobileDevice.created_at.desc()).all()
@@ -1142,6 +1145,8 @@ def dashboard():
 @login_required
 def export_dashboard_excel():
     """تصدير بيانات العمليات المفلترة من Dashboard إلى Excel"""
+    from openpyxl import Workbook
+    from openpyxl.styles import Font, PatternFill, Alignment
     try:
         # معاملات البحث والفلترة
         search = request.args.get('search', '').strip()
@@ -0,0 +1,96 @@
+"""
+واجهة الرفع المجزأ القابل للاستئناف لنماذج الجوال (التسليم/الاستلام والفحص)
+
+التطبيق يرفع كل صورة على دفعات قبل إرسال النموذج، ثم يرسل معرفات الرفع
+في الحقل upload_ids بدلاً من الملفات نفسها. التفاصيل في services/upload_sessions.py
+العميل في المتصفح: static/js/chunked_upload.js (نموذج التسليم/الاستلام mobile/vehicle_checklist.html)
+"""
+from flask import Blueprint, jsonify, request
+from flask_login import login_required, current_user
+
+from app import db
+from services import upload_sessions
+from services.upload_sessions import UploadError
+
+mobile_uploads_bp = Blueprint('mobile_uploads', __name__, url_prefix='/mobile/uploads')
+
+
+def _error(e):
+    return jsonify({'success': False, 'error': str(e)}), getattr(e, 'status', 400)
+
+
+@mobile_uploads_bp.route('', methods=['POST'])
+@login_required
+def start():
+    """بدء جلسة رفع جديدة"""
+    data = request.get_json(silent=True) or request.form
+    try:
+        session_info = upload_sessions.start_upload(
+            current_user.id,
+            data.get('filename'),
+            data.get('size'),
+            data.get('sha256')
+        )
+    except UploadError as e:
+        return _error(e)
+    return jsonify({'success': True, **session_info}), 201
+
+
+@mobile_uploads_bp.route('/<upload_id>', methods=['GET', 'HEAD'])
+@login_required
+def status(upload_id):
+    """الإزاحة الحالية لاستئناف رفع منقطع"""
+    try:
+        info = upload_sessions.upload_status(upload_id, current_user.id)
+    except UploadError as e:
+        return _error(e)
+    response = jsonify({'success': True, **info})
+    response.headers['Upload-Offset'] = str(info['offset'])
+    return response
+
+
+@mobile_uploads_bp.route('/<upload_id>', methods=['PUT', 'PATCH'])
+@login_required
+def append(upload_id):
+    """
+    رفع دفعة: جسم الطلب هو البيانات الخام للدفعة (application/octet-stream)
+    والإزاحة في الترويسة Upload-Offset أو المعامل offset
+    """
+    offset = request.headers.get('Upload-Offset', request.args.get('offset'))
+    try:
+        offset = int(offset)
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'error': 'الإزاحة مطلوبة'}), 400
+
+    try:
+        # request.stream يقرأ جسم الطلب مباشرة دون تحليله أو تخزينه في الذاكرة
+        new_offset = upload_sessions.append_chunk(
+            upload_id, current_user.id, offset, request.stream, request.content_length
+        )
+    except UploadError as e:
+        response, code = _error(e)
+        if code == 409:
+            try:
+                response.headers['Upload-Offset'] = str(
+                    upload_sessions.upload_status(upload_id, current_user.id)['offset'])
+            except UploadError:
+                pass
+        return response, code
+
+    response = jsonify({'success': True, 'offset': new_offset})
+    response.headers['Upload-Offset'] = str(new_offset)
+    return response
+
+
+@mobile_uploads_bp.route('/<upload_id>/complete', methods=['POST'])
+@login_required
+def complete(upload_id):
+    """إنهاء الرفع ونقل الملف إلى مخزن الملفات"""
+    try:
+        result = upload_sessions.complete_upload(upload_id, current_user.id)
+        db.session.commit()
+    except UploadError as e:
+        db.session.rollback()
+        return _error(e)
+
+    return jsonify({'success': True, 'upload_id': upload_id, **result})
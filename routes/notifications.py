@@ -1,7 +1,17 @@
-from flask import Blueprint, render_template, jsonify, request, url_for, redirect
+import json
+import time
+
+from flask import Blueprint, render_template, jsonify, request, url_for, redirect, Response, current_app, stream_with_context
 from flask_login import login_required, current_user
 from datetime import datetime
 from models import Notification, User, db
+from services import notification_hub
+from services.notification_hub import USER
+
+# مهلة الانتظار الطويل، ومدة اتصال البث قبل أن يعيد المتصفح الاتصال تلقائياً
+LONG_POLL_TIMEOUT = 25
+STREAM_MAX_AGE = 300
+STREAM_HEARTBEAT = 15
 
 notifications_bp = Blueprint('notifications', __name__, url_prefix='/notifications')
 
@@ -27,9 +37,10 @@ def index():
     # تحديث حالة قراءة الإشعارات المعروضة
     unread_ids = [n.id for n in notifications.items if not n.is_read]
     if unread_ids:
-        Notification.query.filter(Notification.id.in_(unread_ids)).update(
+        updated = Notification.query.filter(Notification.id.in_(unread_ids)).update(
             {'is_read': True, 'read_at': datetime.utcnow()}, synchronize_session=False
         )
+        notification_hub.record_change(USER, current_user.id, -updated)
         db.session.commit()
     
     return render_template('notifications/index.html', notifications=notifications)
@@ -56,18 +67,102 @@ def view_detail(notification_id):
 @notifications_bp.route('/unread-count', methods=['GET'])
 def unread_count():
     """الحصول على عدد الإشعارات غير المقروءة"""
+    # العداد من ذاكرة مركز الإشعارات، دون استعلام في الحالة المعتادة
     # إذا كان المستخدم مسجل دخول
     if current_user.is_authenticated:
-        count = Notification.query.filter_by(user_id=current_user.id, is_read=False).count()
-        return jsonify({'unread_count': count})
+        user_id = current_user.id
     else:
         # الحصول على أول مستخدم (للاختبار)
-        from models import User
         first_user = User.query.first()
-        if first_user:
-            count = Notification.query.filter_by(user_id=first_user.id, is_read=False).count()
-            return jsonify({'unread_count': count})
-        return jsonify({'unread_count': 0})
+        if not first_user:
+            return jsonify({'unread_count': 0})
+        user_id = first_user.id
+    return jsonify({
+        'unread_count': notification_hub.unread_count(USER, user_id),
+        'version': notification_hub.signal_version(USER, user_id)
+    })
+
+
+@notifications_bp.route('/poll', methods=['GET'])
+@login_required
+def poll():
+    """
+    انتظار طويل: يرد فوراً إذا تغيرت الإشعارات منذ الإصدار since، وإلا ينتظر
+    حتى يصل إشعار أو تنتهي المهلة. last_id لجلب الإشعارات الجديدة فقط.
+    """
+    user_id = current_user.id
+    since = request.args.get('since', type=int)
+    last_id = request.args.get('last_id', type=int)
+
+    version = notification_hub.signal_version(USER, user_id)
+    if since is not None and since == version:
+        # تحرير اتصال قاعدة البيانات أثناء الانتظار
+        db.session.close()
+        version = notification_hub.wait_for_change(USER, user_id, since, LONG_POLL_TIMEOUT)
+
+    notifications = []
+    if last_id is not None and version != since:
+        notifications = [notification_hub.serialize_notification(n)
+                         for n in notification_hub.notifications_after(user_id, last_id)]
+    if last_id is None or notifications:
+        last_id = notifications[-1]['id'] if notifications else notification_hub.latest_notification_id(user_id)
+
+    return jsonify({
+        'unread_count': notification_hub.unread_count(USER, user_id),
+        'version': version,
+        'last_id': last_id,
+        'notifications': notifications
+    })
+
+
+@notifications_bp.route('/stream', methods=['GET'])
+@login_required
+def stream():
+    """
+    بث الإشعارات الجديدة وعدد غير المقروء عبر Server-Sent Events
+
+    كل اتصال مفتوح يشغل عاملاً طوال مدته، لذا البث معطل افتراضياً ويُفعَّل بالإعداد
+    NOTIFICATIONS_STREAM_ENABLED مع عمال غير متزامنين (gevent) أو خيوط (gthread).
+    """
+    if not current_app.config.get('NOTIFICATIONS_STREAM_ENABLED'):
+        return jsonify({'success': False, 'error': 'البث غير مفعل، استخدم /notifications/poll'}), 503
+
+    user_id = current_user.id
+    last_id = request.headers.get('Last-Event-ID', type=int)
+    if last_id is None:
+        last_id = request.args.get('last_id', type=int)
+    if last_id is None:
+        last_id = notification_hub.latest_notification_id(user_id)
+    version = notification_hub.signal_version(USER, user_id)
+    count = notification_hub.unread_count(USER, user_id)
+    db.session.close()
+
+    def events():
+        nonlocal last_id, version
+        yield "retry: 5000\n\n"
+        yield f"event: count\ndata: {json.dumps({'unread_count': count})}\n\n"
+        started = time.monotonic()
+        while time.monotonic() - started < STREAM_MAX_AGE:
+            new_version = notification_hub.wait_for_change(USER, user_id, version, STREAM_HEARTBEAT)
+            if new_version == version:
+                yield ": ping\n\n"
+                continue
+            version = new_version
+            try:
+                for notification in notification_hub.notifications_after(user_id, last_id):
+                    last_id = notification.id
+                    payload = json.dumps(notification_hub.serialize_notification(notification), ensure_ascii=False)
+                    yield f"id: {last_id}\nevent: notification\ndata: {payload}\n\n"
+                unread = notification_hub.unread_count(USER, user_id)
+            finally:
+                db.session.close()
+            yield f"event: count\ndata: {json.dumps({'unread_count': unread})}\n\n"
+
+    response = Response(stream_with_context(events()), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    # منع nginx من تجميع البث في ذاكرته
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
 
 
 @notifications_bp.route('/<int:notification_id>/mark-as-read', methods=['POST'])
@@ -90,9 +185,10 @@ def mark_as_read(notification_id):
 @login_required
 def mark_all_as_read():
     """تحديث جميع الإشعارات كمقروءة"""
-    Notification.query.filter_by(user_id=current_user.id, is_read=False).update(
+    updated = Notification.query.filter_by(user_id=current_user.id, is_read=False).update(
         {'is_read': True, 'read_at': datetime.utcnow()}, synchronize_session=False
     )
+    notification_hub.record_change(USER, current_user.id, -updated)
     db.session.commit()
     return jsonify({'success': True})
 
@@ -263,11 +359,42 @@ def create_accident_notification(user_id, vehicle_plate, driver_name, accident_t
 
 
 def get_all_admin_users():
-    """الحصول على جميع المستخدمين الإداريين"""
+    """جميع المستخدمين؛ إشعارات النظام تُرسل لكل المستخدمين وليس للإداريين فقط"""
     from models import User
     return User.query.all()
 
 
+def get_all_user_ids():
+    """معرفات جميع المستخدمين (مستلمو إشعارات النظام)، دون تحميل كائنات المستخدمين"""
+    return [user_id for (user_id,) in db.session.query(User.id).all()]
+
+
+def notify_users(user_ids, notification_type, title, description,
+                 related_entity_type=None, related_entity_id=None,
+                 priority='normal', action_url=None):
+    """
+    إرسال نفس الإشعار لعدة مستخدمين بعبارة INSERT واحدة
+
+    الحفظ مسؤولية المستدعي (db.session.commit)
+    :return: عدد الإشعارات المنشأة
+    """
+    return notification_hub.bulk_create(
+        user_ids,
+        notification_type=notification_type,
+        title=title,
+        description=description,
+        related_entity_type=related_entity_type,
+        related_entity_id=related_entity_id,
+        priority=priority,
+        action_url=action_url
+    )
+
+
+def notify_all_users(notification_type, title, description, **kwargs):
+    """إرسال إشعار لجميع المستخدمين دفعة واحدة"""
+    return notify_users(get_all_user_ids(), notification_type, title, description, **kwargs)
+
+
 @notifications_bp.route('/test/create-demo-notifications', methods=['GET', 'POST'])
 def create_demo_notifications():
     """إنشاء إشعارات تجريبية لاختبار النظام - لجميع المستخدمين"""
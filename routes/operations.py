@@ -20,17 +20,13 @@ import os
 import uuid
 import io
 import urllib.parse
-import pandas as pd
-from fpdf import FPDF
 import base64
 import uuid
-import zipfile
-import shutil
 
 from app import db
 from models import (
-        Vehicle, VehicleRental, VehicleWorkshop, VehicleWorkshopImage, 
-        VehicleProject, VehicleHandover, VehicleHandoverImage, SystemAudit,
+        Vehicle, VehicleRental, VehicleWorkshop,
+        VehicleProject, VehicleHandover, SystemAudit,
         VehiclePeriodicInspection, VehicleSafetyCheck, VehicleAccident, Employee,
         Department, ExternalAuthorization, Module, Permission, UserRole,
         VehicleExternalSafetyCheck, OperationRequest
@@ -38,22 +34,11 @@ from models import (
 from utils.audit_logger import log_activity
 from utils.audit_logger import log_audit
 from utils.whatsapp_message_generator import generate_whatsapp_url
-from utils.vehicles_export import export_vehicle_pdf, export_workshop_records_pdf, export_vehicle_excel, export_workshop_records_excel
-from utils.simple_pdf_generator import create_vehicle_handover_pdf as generate_complete_vehicle_report
-from utils.vehicle_excel_report import generate_complete_vehicle_excel_report
 from services.email_service import EmailService
 from utils.unified_storage_service import unified_storage
 # from utils.workshop_report import generate_workshop_report_pdf
 # from utils.html_to_pdf import generate_pdf_from_template
 # from utils.fpdf_arabic_report import generate_workshop_report_pdf_fpdf
-from reportlab.lib.pagesizes import A4
-from reportlab.lib import colors
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.ttfonts import TTFont
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle, Image
-import arabic_reshaper
-from bidi.algorithm import get_display
 # from utils.fpdf_handover_pdf import generate_handover_report_pdf
 # ============ تأكد من وجود هذه الاستيرادات في أعلى الملف ============
 from datetime import date
@@ -837,8 +822,7 @@ def create_operation_request(operation_type, related_record_id, vehicle_id,
         
         # إنشاء إشعارات لجميع المستخدمين (نظام الإشعارات الجديد)
         try:
-            from models import Notification
-            all_users = User.query.all()
+            from routes.notifications import notify_all_users
             
             vehicle_info = ""
             if vehicle_id:
@@ -846,21 +830,16 @@ def create_operation_request(operation_type, related_record_id, vehicle_id,
                 if vehicle:
                     vehicle_info = f" - المركبة {vehicle.plate_number}"
             
-            for user in all_users:
-                try:
-                    new_notification = Notification(
-                        user_id=user.id,
-                        notification_type='operations',
-                        title=f'عملية جديدة{vehicle_info}',
-                        description=description,
-                        related_entity_type='operation',
-                        related_entity_id=operation.id,
-                        priority='high' if priority == 'urgent' else 'normal',
-                        action_url=url_for('operations.view_operation', operation_id=operation.id)
-                    )
-                    db.session.add(new_notification)
-                except Exception as e:
-                    current_app.logger.error(f'خطأ في إنشاء إشعار للمستخدم {user.id}: {str(e)}')
+            # إشعار واحد لكل مستخدم بعبارة INSERT واحدة
+            notify_all_users(
+                notification_type='operations',
+                title=f'عملية جديدة{vehicle_info}',
+                description=description,
+                related_entity_type='operation',
+                related_entity_id=operation.id,
+                priority='high' if priority == 'urgent' else 'normal',
+                action_url=url_for('operations.view_operation', operation_id=operation.id)
+            )
         except Exception as e:
             current_app.logger.error(f'خطأ في إنشاء إشعارات العمليات الجديدة: {str(e)}')
         
@@ -915,7 +894,7 @@ def get_unread_notifications_count(user_id):
 def test_operations_notifications():
     """اختبار إنشاء إشعارات العمليات لجميع المستخدمين"""
     try:
-        from models import Notification
+        from routes.notifications import notify_users, get_all_user_ids
         
         # الحصول على آخر عملية
         last_operation = OperationRequest.query.order_by(OperationRequest.id.desc()).first()
@@ -923,7 +902,7 @@ def test_operations_notifications():
         if not last_operation:
             return jsonify({'success': False, 'message': 'لا توجد عمليات'}), 404
         
-        all_users = User.query.all()
+        user_ids = get_all_user_ids()
         
         vehicle_info = ""
         if last_operation.vehicle_id:
@@ -931,23 +910,16 @@ def test_operations_notifications():
             if vehicle:
                 vehicle_info = f" - المركبة {vehicle.plate_number}"
         
-        notification_count = 0
-        for user in all_users:
-            try:
-                new_notification = Notification(
-                    user_id=user.id,
-                    notification_type='operations',
-                    title=f'عملية جديدة{vehicle_info}',
-                    description=last_operation.description or 'عملية تحتاج مراجعة',
-                    related_entity_type='operation',
-                    related_entity_id=last_operation.id,
-                    priority='normal',
-                    action_url=url_for('operations.view_operation', operation_id=last_operation.id)
-                )
-                db.session.add(new_notification)
-                notification_count += 1
-            except Exception as e:
-                current_app.logger.error(f'خطأ في إنشاء إشعار للمستخدم {user.id}: {str(e)}')
+        notification_count = notify_users(
+            user_ids,
+            notification_type='operations',
+            title=f'عملية جديدة{vehicle_info}',
+            description=last_operation.description or 'عملية تحتاج مراجعة',
+            related_entity_type='operation',
+            related_entity_id=last_operation.id,
+            priority='normal',
+            action_url=url_for('operations.view_operation', operation_id=last_operation.id)
+        )
         
         db.session.commit()
         
@@ -955,7 +927,7 @@ def test_operations_notifications():
             'success': True,
             'message': f'تم إنشاء {notification_count} إشعار للعملية {last_operation.id}',
             'operation_id': last_operation.id,
-            'users_count': len(all_users)
+            'users_count': len(user_ids)
         })
     except Exception as e:
         current_app.logger.error(f'خطأ في اختبار الإشعارات: {str(e)}')
@@ -1584,7 +1556,7 @@ def send_operation_email(operation_id):
                     )
                 
                 if result.get('success'):
-                    current_app.logger.info(f'تم إرسال الإيميل بنجاح عبر SendGrid إلى {to_email}')
+                    current_app.logger.info(f'تمت إضافة الإيميل إلى قائمة الإرسال (SendGrid) إلى {to_email}')
                 else:
                     # عرض رسالة تفصيلية عن المشكلة والحل
                     error_details = result.get('solution', 'يتطلب إعداد مُرسل مُتحقق في SendGrid')
@@ -1594,6 +1566,8 @@ def send_operation_email(operation_id):
                     
             except Exception as sendgrid_error:
                 current_app.logger.warning(f'فشل إرسال الإيميل عبر SendGrid: {sendgrid_error}')
+                # إلغاء ما أُضيف للقائمة قبل الفشل حتى لا يُحفظ إيميل ناقص
+                db.session.rollback()
                 
                 # استخدام النظام الاحتياطي
                 try:
@@ -1626,6 +1600,10 @@ def send_operation_email(operation_id):
                         'message': f'فشل في إرسال الإيميل: {str(fallback_error)}'
                     }
             
+            # حفظ الإيميل في قائمة الإرسال (يبدأ إرساله بعد الحفظ)
+            if result.get('success'):
+                db.session.commit()
+            
             # تسجيل العملية
             log_audit(
                 user_id=current_user.id,
@@ -1945,208 +1923,38 @@ def share_data(operation_id):
 @operations_bp.route('/<int:operation_id>/share-package', methods=['GET'])
 @login_required
 def share_package(operation_id):
-    """إنشاء حزمة ZIP شاملة للمشاركة الخارجية"""
+    """حزمة ZIP شاملة للمشاركة الخارجية تُبث مباشرة من التخزين (services/share_packages)"""
+    from flask import Response, stream_with_context
+    from services import share_packages
     
     operation = OperationRequest.query.get_or_404(operation_id)
     
-    # مسار مجلد مؤقت لتجميع الملفات في مجلد آمن بدلاً من /tmp
-    temp_dir = os.path.join(current_app.static_folder, '.temp', f'operation_{operation_id}_{datetime.now().strftime("%Y%m%d_%H%M%S")}')
-    zip_path = None
-    
     try:
-        os.makedirs(temp_dir, exist_ok=True)
-        
-        # 1. إنشاء ملف نصي بالتفاصيل
-        details_path = os.path.join(temp_dir, 'تفاصيل_العملية.txt')
-        with open(details_path, 'w', encoding='utf-8') as f:
-            f.write('═' * 50 + '\n')
-            f.write(f'          تفاصيل العملية #{operation.id}\n')
-            f.write('═' * 50 + '\n\n')
-            
-            # نوع العملية
-            operation_types = {
-                'handover': 'تسليم/استلام مركبة',
-                'workshop': 'ورشة صيانة',
-                'external_authorization': 'تفويض خارجي',
-                'safety_inspection': 'فحص سلامة'
-            }
-            f.write(f'نوع العملية: {operation_types.get(operation.operation_type, operation.operation_type)}\n')
-            f.write(f'الحالة: {operation.status}\n')
-            f.write(f'التاريخ: {operation.created_at.strftime("%Y/%m/%d %H:%M")}\n\n')
-            
-            # معلومات المركبة
-            if operation.vehicle:
-                f.write('─' * 50 + '\n')
-                f.write('معلومات المركبة:\n')
-                f.write('─' * 50 + '\n')
-                f.write(f'رقم اللوحة: {operation.vehicle.plate_number}\n')
-                f.write(f'النوع: {operation.vehicle.make} {operation.vehicle.model}\n')
-                
-                # محاولة الحصول على السائق من آخر عملية تسليم
-                last_handover = VehicleHandover.query.filter_by(
-                    vehicle_id=operation.vehicle.id,
-                    handover_type='delivery'
-                ).order_by(VehicleHandover.handover_date.desc()).first()
-                
-                if last_handover and last_handover.person_name:
-                    f.write(f'السائق الحالي: {last_handover.person_name}\n')
-                f.write('\n')
-            
-            # تفاصيل خاصة بنوع العملية
-            if operation.operation_type == 'handover' and operation.related_record_id:
-                handover = VehicleHandover.query.get(operation.related_record_id)
-                if handover:
-                    f.write('─' * 50 + '\n')
-                    f.write('تفاصيل التسليم/الاستلام:\n')
-                    f.write('─' * 50 + '\n')
-                    f.write(f'النوع: {"تسليم" if handover.handover_type == "delivery" else "استلام"}\n')
-                    f.write(f'اسم المستلم: {handover.person_name}\n')
-                    f.write(f'المسافة المقطوعة: {handover.mileage} كم\n')
-                    if handover.city:
-                        f.write(f'المدينة: {handover.city}\n')
-                    if handover.project_name:
-                        f.write(f'المشروع: {handover.project_name}\n')
-                    if handover.notes:
-                        f.write(f'\nملاحظات:\n{handover.notes}\n')
-                    f.write('\n')
-            
-            elif operation.operation_type == 'workshop' and operation.related_record_id:
-                workshop = VehicleWorkshop.query.get(operation.related_record_id)
-                if workshop:
-                    f.write('─' * 50 + '\n')
-                    f.write('تفاصيل الورشة:\n')
-                    f.write('─' * 50 + '\n')
-                    f.write(f'السبب: {workshop.reason}\n')
-                    f.write(f'تاريخ الدخول: {workshop.entry_date.strftime("%Y/%m/%d")}\n')
-                    if workshop.exit_date:
-                        f.write(f'تاريخ الخروج: {workshop.exit_date.strftime("%Y/%m/%d")}\n')
-                    if workshop.notes:
-                        f.write(f'\nملاحظات:\n{workshop.notes}\n')
-                    f.write('\n')
-            
-            # معلومات إضافية
-            if operation.description:
-                f.write('─' * 50 + '\n')
-                f.write('الوصف:\n')
-                f.write('─' * 50 + '\n')
-                f.write(f'{operation.description}\n\n')
-            
-            f.write('═' * 50 + '\n')
-            f.write('تم إنشاء هذا الملف من نظام نُظم لإدارة المركبات\n')
-            f.write('═' * 50 + '\n')
-        
-        # 2. إنشاء ملف Excel
-        try:
-            excel_path = os.path.join(temp_dir, f'بيانات_العملية_{operation_id}.xlsx')
-            from openpyxl import Workbook
-            from openpyxl.styles import Font, PatternFill, Alignment
-            
-            wb = Workbook()
-            ws = wb.active
-            ws.title = 'تفاصيل العملية'
-            
-            # إضافة البيانات
-            ws['A1'] = 'البيان'
-            ws['B1'] = 'القيمة'
-            ws['A1'].font = Font(bold=True)
-            ws['B1'].font = Font(bold=True)
-            
-            row = 2
-            ws[f'A{row}'] = 'رقم العملية'
-            ws[f'B{row}'] = f'#{operation.id}'
-            row += 1
-            
-            ws[f'A{row}'] = 'نوع العملية'
-            ws[f'B{row}'] = operation_types.get(operation.operation_type, operation.operation_type)
-            row += 1
-            
-            if operation.vehicle:
-                ws[f'A{row}'] = 'رقم اللوحة'
-                ws[f'B{row}'] = operation.vehicle.plate_number
-                row += 1
-            
-            wb.save(excel_path)
-        except Exception as e:
-            current_app.logger.warning(f'فشل في إنشاء Excel: {str(e)}')
-            excel_path = None
-        
-        # 3. إنشاء ملف PDF
-        pdf_path = None
-        if operation.operation_type == 'handover' and operation.related_record_id:
-            try:
-                from utils.simple_pdf_generator import create_vehicle_handover_pdf
-                pdf_content = create_vehicle_handover_pdf(operation.related_record_id)
-                pdf_path = os.path.join(temp_dir, f'تقرير_العملية_{operation_id}.pdf')
-                with open(pdf_path, 'wb') as f:
-                    f.write(pdf_content)
-            except Exception as e:
-                current_app.logger.warning(f'فشل في إنشاء PDF: {str(e)}')
-                pdf_path = None
-        
-        # 4. نسخ الصور المرفقة
-        images_copied = 0
-        if operation.operation_type == 'handover' and operation.related_record_id:
-            handover_images = VehicleHandoverImage.query.filter_by(handover_record_id=operation.related_record_id).all()
-            for img in handover_images:
-                try:
-                    src_path = os.path.join('static/uploads/handover_images', img.get_path())
-                    if os.path.exists(src_path):
-                        dst_path = os.path.join(temp_dir, f'صورة_{images_copied + 1}_{os.path.basename(img.get_path())}')
-                        shutil.copy2(src_path, dst_path)
-                        images_copied += 1
-                except Exception as e:
-                    current_app.logger.warning(f'فشل في نسخ الصورة: {str(e)}')
-        
-        elif operation.operation_type == 'workshop' and operation.related_record_id:
-            workshop_images = VehicleWorkshopImage.query.filter_by(workshop_record_id=operation.related_record_id).all()
-            for img in workshop_images:
-                try:
-                    src_path = os.path.join('static/uploads/workshop_images', img.image_path)
-                    if os.path.exists(src_path):
-                        dst_path = os.path.join(temp_dir, f'صورة_{images_copied + 1}_{os.path.basename(img.image_path)}')
-                        shutil.copy2(src_path, dst_path)
-                        images_copied += 1
-                except Exception as e:
-                    current_app.logger.warning(f'فشل في نسخ الصورة: {str(e)}')
-        
-        # 5. إنشاء ملف ZIP
-        # حفظ ملف ZIP في مجلد آمن بدلاً من /tmp
-        zip_dir = os.path.join(current_app.static_folder, '.temp')
-        os.makedirs(zip_dir, exist_ok=True)
-        zip_path = os.path.join(zip_dir, f'operation_{operation_id}_package.zip')
-        with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-            for root, dirs, files in os.walk(temp_dir):
-                for file in files:
-                    file_path = os.path.join(root, file)
-                    arcname = os.path.relpath(file_path, temp_dir)
-                    zipf.write(file_path, arcname)
-        
-        # تسجيل العملية
-        log_audit(
-            user_id=current_user.id,
-            action='share_package',
-            entity_type='operation_request',
-            entity_id=operation.id,
-            details=f'إنشاء حزمة مشاركة شاملة للعملية {operation_id}'
-        )
-        
-        # إرسال الملف
-        return send_file(
-            zip_path,
-            mimetype='application/zip',
-            as_attachment=True,
-            download_name=f'عملية_{operation_id}_شاملة.zip'
-        )
-    
+        # المحتوى (التفاصيل و Excel ومسارات الصور) قبل بدء الإرسال ليظهر أي خطأ كرسالة
+        share_packages.build_manifest(operation)
     except Exception as e:
         current_app.logger.error(f"خطأ في إنشاء حزمة المشاركة للعملية {operation_id}: {str(e)}")
         flash(f'حدث خطأ: {str(e)}', 'danger')
         return redirect(url_for('operations.view_operation', operation_id=operation_id))
     
-    finally:
-        # 💾 جميع الملفات والمجلدات تبقى محفوظة بشكل دائم في static/.temp/
-        # لا يتم حذف أي شيء - كل المعالجات آمنة
-        pass
+    # تسجيل العملية
+    log_audit(
+        user_id=current_user.id,
+        action='share_package',
+        entity_type='operation_request',
+        entity_id=operation.id,
+        details=f'إنشاء حزمة مشاركة شاملة للعملية {operation_id}'
+    )
+    
+    response = Response(stream_with_context(share_packages.stream(operation)), mimetype='application/zip')
+    # اسم ASCII بديل مع الاسم العربي (RFC 5987) كما يفعل send_file
+    download_name = urllib.parse.quote(f'عملية_{operation_id}_شاملة.zip')
+    response.headers['Content-Disposition'] = (
+        f"attachment; filename=operation_{operation_id}_package.zip; filename*=UTF-8''{download_name}")
+    # بدون تجميع الاستجابة في nginx حتى يبدأ التنزيل مع أول دفعة
+    response.headers['X-Accel-Buffering'] = 'no'
+    response.headers['Cache-Control'] = 'no-store'
+    return response
 
 
 def get_operation_type_name(operation_type):
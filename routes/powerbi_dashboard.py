@@ -10,6 +10,7 @@ from app import db
 from models import Employee, Attendance, Document, Vehicle, Department
 from sqlalchemy import func, or_, and_, case
 from utils.user_helpers import require_module_access
+from services import search_index
 from models import Module, Permission
 import csv
 from io import StringIO, BytesIO
@@ -407,9 +408,8 @@ def documents_status():
         for doc_info in required_docs:
             doc_type = doc_info['type']
             
-            docs = Document.query.filter(
-                Document.document_type.ilike(f'%{doc_type}%')
-            ).all()
+            # من فهرس البحث: يطابق الاسم العربي للنوع مع رمزه المخزن (national_id ...)
+            docs = search_index.filter_query(Document.query, 'document', doc_type, fuzzy=False, order=False).all()
             
             available = len(docs)
             missing = total_employees - available
@@ -623,843 +623,24 @@ def vehicle_operations_summary():
 @login_required
 def export_data():
     """تصدير البيانات بصيغة Excel احترافية بتصميم Power BI - نفس تصميم الصفحة"""
-    from openpyxl import Workbook
-    from openpyxl.styles import Font, PatternFill, Border, Side, Alignment
-    from openpyxl.utils import get_column_letter
-    from openpyxl.chart import BarChart, PieChart, DoughnutChart, Reference
-    from openpyxl.chart.label import DataLabelList
-    from sqlalchemy import func
+    from services.powerbi_export_service import get_export_file
     
     data_type = request.args.get('type', 'all')
     date_from = request.args.get('date_from')
     date_to = request.args.get('date_to')
-    department_id = request.args.get('department_id')
+    department_id = request.args.get('department_id', type=int)
     
     try:
-        wb = Workbook()
-        
-        # ألوان التصميم المميز - Professional Dark Theme
-        dark_bg = PatternFill(start_color="0A0E17", end_color="0A0E17", fill_type="solid")
-        card_fill = PatternFill(start_color="131B2E", end_color="131B2E", fill_type="solid")
-        card_fill_alt = PatternFill(start_color="1A2540", end_color="1A2540", fill_type="solid")
-        header_fill = PatternFill(start_color="0D1321", end_color="0D1321", fill_type="solid")
-        title_bg = PatternFill(start_color="00D4AA", end_color="00D4AA", fill_type="solid")
-        
-        # ألوان cyan/teal gradient effect
-        cyan_fill = PatternFill(start_color="00D4FF", end_color="00D4FF", fill_type="solid")
-        teal_fill = PatternFill(start_color="00F5D4", end_color="00F5D4", fill_type="solid")
-        cyan_dark = PatternFill(start_color="0891B2", end_color="0891B2", fill_type="solid")
-        
-        # ألوان الحالات - Professional
-        green_fill = PatternFill(start_color="00FF88", end_color="00FF88", fill_type="solid")
-        green_dark = PatternFill(start_color="10B981", end_color="10B981", fill_type="solid")
-        red_fill = PatternFill(start_color="FF4757", end_color="FF4757", fill_type="solid")
-        orange_fill = PatternFill(start_color="FFD700", end_color="FFD700", fill_type="solid")
-        blue_fill = PatternFill(start_color="3B82F6", end_color="3B82F6", fill_type="solid")
-        purple_fill = PatternFill(start_color="7B68EE", end_color="7B68EE", fill_type="solid")
-        
-        # خطوط احترافية
-        title_font = Font(bold=True, color="00D4FF", size=28, name='Arial')
-        subtitle_font = Font(color="8892A0", size=11, name='Arial')
-        section_font = Font(bold=True, color="00D4FF", size=16, name='Arial')
-        cyan_font = Font(bold=True, color="00D4FF", size=13, name='Arial')
-        white_font = Font(bold=True, color="FFFFFF", size=12, name='Arial')
-        dark_font = Font(bold=True, color="0A0E17", size=12, name='Arial')
-        kpi_value_font = Font(bold=True, color="00D4FF", size=32, name='Arial')
-        kpi_label_font = Font(bold=True, color="8892A0", size=11, name='Arial')
-        data_font = Font(color="E8EAED", size=11, name='Arial')
-        
-        # حدود احترافية
-        cyan_border = Border(
-            left=Side(style='medium', color='00D4FF'),
-            right=Side(style='medium', color='00D4FF'),
-            top=Side(style='medium', color='00D4FF'),
-            bottom=Side(style='medium', color='00D4FF')
-        )
-        cyan_border_thin = Border(
-            left=Side(style='thin', color='00D4FF'),
-            right=Side(style='thin', color='00D4FF'),
-            top=Side(style='thin', color='00D4FF'),
-            bottom=Side(style='thin', color='00D4FF')
-        )
-        thin_border = Border(
-            left=Side(style='thin', color='2D3748'),
-            right=Side(style='thin', color='2D3748'),
-            top=Side(style='thin', color='2D3748'),
-            bottom=Side(style='thin', color='2D3748')
-        )
-        accent_border = Border(
-            bottom=Side(style='medium', color='00D4FF')
-        )
-        
-        # معالجة التواريخ
         d_from = datetime.strptime(date_from, '%Y-%m-%d').date() if date_from else (datetime.now().date() - timedelta(days=30))
         d_to = datetime.strptime(date_to, '%Y-%m-%d').date() if date_to else datetime.now().date()
         
-        # جلب الموظفين النشطين الذين لهم حضور في الفترة
-        active_employee_ids_with_attendance = db.session.query(Attendance.employee_id).filter(
-            Attendance.date >= d_from,
-            Attendance.date <= d_to
-        ).distinct().all()
-        active_employee_ids_with_attendance = [e[0] for e in active_employee_ids_with_attendance]
-        
-        # عدد الموظفين النشطين الذين لهم حضور
-        total_employees = Employee.query.filter(
-            Employee.status == 'active',
-            Employee.id.in_(active_employee_ids_with_attendance)
-        ).count()
-        
-        # باقي الإحصائيات
-        total_vehicles = Vehicle.query.count()
-        in_project_vehicles = Vehicle.query.filter_by(status='in_project').count()
-        in_workshop_vehicles = Vehicle.query.filter_by(status='in_workshop').count()
-        out_of_service_vehicles = Vehicle.query.filter_by(status='out_of_service').count()
-        accident_vehicles = Vehicle.query.filter_by(status='accident').count()
-        total_documents = Document.query.count()
-        total_departments = Department.query.count()
-        
-        # سجلات الحضور للموظفين النشطين فقط
-        active_emp_ids = [e.id for e in Employee.query.filter(Employee.status == 'active').all()]
-        
-        attendance_records = Attendance.query.filter(
-            Attendance.date >= d_from,
-            Attendance.date <= d_to,
-            Attendance.employee_id.in_(active_emp_ids)
-        ).all()
-        
-        att_data = {
-            'present': sum(1 for a in attendance_records if a.status == 'present'),
-            'absent': sum(1 for a in attendance_records if a.status in ['absent', 'غائب']),
-            'leave': sum(1 for a in attendance_records if a.status == 'leave'),
-            'sick': sum(1 for a in attendance_records if a.status == 'sick')
-        }
-        total_attendance = sum(att_data.values())
-        
-        ws = wb.active
-        ws.title = "Power BI Dashboard"
-        ws.sheet_view.rightToLeft = True
-        
-        # تعبئة الخلفية الداكنة لكل الصفحة
-        for row in range(1, 70):
-            for col in range(1, 22):
-                ws.cell(row=row, column=col).fill = dark_bg
-        
-        # عرض الأعمدة المتناسق
-        column_widths = [18, 16, 14, 14, 16, 14, 14, 14, 14, 14, 14, 14, 14, 14, 14, 14, 14, 14, 14, 14, 14]
-        for i, width in enumerate(column_widths, 1):
-            ws.column_dimensions[get_column_letter(i)].width = width
-        
-        # === الترويسة الرئيسية ===
-        ws.merge_cells('A1:U1')
-        ws['A1'] = "لوحة التحليلات الاحترافية | Power BI Dashboard"
-        ws['A1'].font = title_font
-        ws['A1'].fill = header_fill
-        ws['A1'].alignment = Alignment(horizontal='center', vertical='center')
-        ws['A1'].border = accent_border
-        ws.row_dimensions[1].height = 55
-        
-        # خط فاصل cyan
-        for col in range(1, 22):
-            ws.cell(row=2, column=col).fill = cyan_fill
-            ws.cell(row=2, column=col).border = Border()
-        ws.row_dimensions[2].height = 4
-        
-        # معلومات التقرير
-        ws.merge_cells('A3:U3')
-        ws['A3'] = f"تاريخ التقرير: {datetime.now().strftime('%Y-%m-%d %H:%M')}   |   الفترة: {d_from} إلى {d_to}   |   نُـظـم - نظام إدارة الموظفين"
-        ws['A3'].font = subtitle_font
-        ws['A3'].fill = card_fill
-        ws['A3'].alignment = Alignment(horizontal='center', vertical='center')
-        ws.row_dimensions[3].height = 30
-        
-        # وصف البيانات
-        ws.merge_cells('A4:U4')
-        ws['A4'] = "البيانات تعكس الموظفين النشطين فقط الذين لديهم سجلات حضور في الفترة المحددة"
-        ws['A4'].font = Font(color="00F5D4", size=10, italic=True, name='Arial')
-        ws['A4'].fill = dark_bg
-        ws['A4'].alignment = Alignment(horizontal='center', vertical='center')
-        ws.row_dimensions[4].height = 22
-        
-        # === بطاقات KPI ===
-        kpi_data = [
-            ("الموظفين النشطين", total_employees, "👥", "A", cyan_fill),
-            ("إجمالي السيارات", total_vehicles, "🚗", "E", teal_fill),
-            ("في المشاريع", in_project_vehicles, "✅", "I", green_fill),
-            ("الأقسام", total_departments, "🏢", "M", purple_fill),
-            ("الوثائق", total_documents, "📄", "Q", orange_fill),
-        ]
-        
-        ws.row_dimensions[5].height = 8
-        ws.row_dimensions[6].height = 30
-        ws.row_dimensions[7].height = 45
-        ws.row_dimensions[8].height = 8
-        
-        for label, value, icon, start_col, accent_fill in kpi_data:
-            col_idx = ord(start_col) - ord('A') + 1
-            end_col = get_column_letter(col_idx + 3)
-            
-            # خط علوي ملون
-            for c in range(col_idx, col_idx + 4):
-                ws.cell(row=5, column=c).fill = accent_fill
-            
-            # التسمية
-            ws.merge_cells(f'{start_col}6:{end_col}6')
-            ws[f'{start_col}6'] = f"{icon}  {label}"
-            ws[f'{start_col}6'].font = kpi_label_font
-            ws[f'{start_col}6'].fill = card_fill
-            ws[f'{start_col}6'].alignment = Alignment(horizontal='center', vertical='center')
-            ws[f'{start_col}6'].border = cyan_border_thin
-            
-            # القيمة
-            ws.merge_cells(f'{start_col}7:{end_col}7')
-            ws[f'{start_col}7'] = value
-            ws[f'{start_col}7'].font = kpi_value_font
-            ws[f'{start_col}7'].fill = card_fill
-            ws[f'{start_col}7'].alignment = Alignment(horizontal='center', vertical='center')
-            ws[f'{start_col}7'].border = cyan_border_thin
-            
-            # خط سفلي
-            for c in range(col_idx, col_idx + 4):
-                ws.cell(row=8, column=c).fill = card_fill_alt
-        
-        # === قسم الحضور ===
-        ws.merge_cells('A10:I10')
-        ws['A10'] = "📊 توزيع حالات الحضور - الموظفين النشطين"
-        ws['A10'].font = section_font
-        ws['A10'].fill = header_fill
-        ws['A10'].alignment = Alignment(horizontal='center', vertical='center')
-        ws['A10'].border = accent_border
-        ws.row_dimensions[10].height = 35
-        
-        att_headers = ['الحالة', 'العدد', 'النسبة', 'الرسم البياني']
-        for i, h in enumerate(att_headers):
-            cell = ws.cell(row=11, column=i+1)
-            cell.value = h
-            cell.font = cyan_font
-            cell.fill = card_fill_alt
-            cell.alignment = Alignment(horizontal='center', vertical='center')
-            cell.border = cyan_border_thin
-        ws.row_dimensions[11].height = 28
-        
-        att_rows = [
-            ('حاضر ✅', att_data['present'], green_fill, "10B981"),
-            ('غائب ❌', att_data['absent'], red_fill, "FF4757"),
-            ('إجازة 📋', att_data['leave'], blue_fill, "3B82F6"),
-            ('مريض 🏥', att_data['sick'], orange_fill, "FFD700")
-        ]
-        
-        for idx, (label, count, fill, bar_color) in enumerate(att_rows, start=12):
-            pct = round((count / total_attendance * 100), 1) if total_attendance > 0 else 0
-            
-            ws.cell(row=idx, column=1).value = label
-            ws.cell(row=idx, column=1).font = white_font
-            ws.cell(row=idx, column=1).fill = card_fill
-            ws.cell(row=idx, column=1).alignment = Alignment(horizontal='center', vertical='center')
-            ws.cell(row=idx, column=1).border = thin_border
-            
-            ws.cell(row=idx, column=2).value = count
-            ws.cell(row=idx, column=2).font = Font(bold=True, color="00D4FF", size=14, name='Arial')
-            ws.cell(row=idx, column=2).fill = card_fill
-            ws.cell(row=idx, column=2).alignment = Alignment(horizontal='center', vertical='center')
-            ws.cell(row=idx, column=2).border = thin_border
-            
-            ws.cell(row=idx, column=3).value = f"{pct}%"
-            ws.cell(row=idx, column=3).font = Font(bold=True, color="00F5D4", size=12, name='Arial')
-            ws.cell(row=idx, column=3).fill = card_fill
-            ws.cell(row=idx, column=3).alignment = Alignment(horizontal='center', vertical='center')
-            ws.cell(row=idx, column=3).border = thin_border
-            
-            bar_width = int(pct / 4) if pct > 0 else 1
-            ws.cell(row=idx, column=4).value = "█" * bar_width
-            ws.cell(row=idx, column=4).font = Font(color=bar_color, size=12, name='Arial')
-            ws.cell(row=idx, column=4).fill = card_fill
-            ws.cell(row=idx, column=4).border = thin_border
-            
-            ws.row_dimensions[idx].height = 26
-        
-        pie1 = PieChart()
-        pie1.title = "توزيع الحضور"
-        labels1 = Reference(ws, min_col=1, min_row=12, max_row=15)
-        data1 = Reference(ws, min_col=2, min_row=11, max_row=15)
-        pie1.add_data(data1, titles_from_data=True)
-        pie1.set_categories(labels1)
-        pie1.width = 10
-        pie1.height = 7
-        pie1.dataLabels = DataLabelList()
-        pie1.dataLabels.showPercent = True
-        pie1.dataLabels.showCatName = True
-        ws.add_chart(pie1, "F11")
-        
-        # === قسم السيارات === (يبدأ من صف 24 لإعطاء مسافة للرسم البياني)
-        veh_start_row = 24
-        ws.merge_cells(f'A{veh_start_row}:E{veh_start_row}')
-        ws[f'A{veh_start_row}'] = "🚗 حالة أسطول السيارات"
-        ws[f'A{veh_start_row}'].font = section_font
-        ws[f'A{veh_start_row}'].fill = header_fill
-        ws[f'A{veh_start_row}'].alignment = Alignment(horizontal='center', vertical='center')
-        ws[f'A{veh_start_row}'].border = accent_border
-        ws.row_dimensions[veh_start_row].height = 35
-        
-        veh_headers = ['الحالة', 'العدد', 'النسبة', 'الرسم']
-        for i, h in enumerate(veh_headers):
-            cell = ws.cell(row=veh_start_row+1, column=i+1)
-            cell.value = h
-            cell.font = cyan_font
-            cell.fill = card_fill_alt
-            cell.alignment = Alignment(horizontal='center', vertical='center')
-            cell.border = cyan_border_thin
-        ws.row_dimensions[veh_start_row+1].height = 28
-        
-        veh_rows = [
-            ('في المشروع 🟢', in_project_vehicles, "10B981"),
-            ('في الورشة 🟡', in_workshop_vehicles, "FFD700"),
-            ('خارج الخدمة 🔴', out_of_service_vehicles, "FF4757"),
-            ('حادث ⚠️', accident_vehicles, "7B68EE")
-        ]
-        
-        for idx, (label, count, bar_color) in enumerate(veh_rows, start=veh_start_row+2):
-            pct = round((count / total_vehicles * 100), 1) if total_vehicles > 0 else 0
-            
-            ws.cell(row=idx, column=1).value = label
-            ws.cell(row=idx, column=1).font = white_font
-            ws.cell(row=idx, column=1).fill = card_fill
-            ws.cell(row=idx, column=1).alignment = Alignment(horizontal='center', vertical='center')
-            ws.cell(row=idx, column=1).border = thin_border
-            
-            ws.cell(row=idx, column=2).value = count
-            ws.cell(row=idx, column=2).font = Font(bold=True, color="00D4FF", size=14, name='Arial')
-            ws.cell(row=idx, column=2).fill = card_fill
-            ws.cell(row=idx, column=2).alignment = Alignment(horizontal='center', vertical='center')
-            ws.cell(row=idx, column=2).border = thin_border
-            
-            ws.cell(row=idx, column=3).value = f"{pct}%"
-            ws.cell(row=idx, column=3).font = Font(bold=True, color="00F5D4", size=12, name='Arial')
-            ws.cell(row=idx, column=3).fill = card_fill
-            ws.cell(row=idx, column=3).alignment = Alignment(horizontal='center', vertical='center')
-            ws.cell(row=idx, column=3).border = thin_border
-            
-            bar_width = int(pct / 4) if pct > 0 else 1
-            ws.cell(row=idx, column=4).value = "█" * bar_width
-            ws.cell(row=idx, column=4).font = Font(color=bar_color, size=12, name='Arial')
-            ws.cell(row=idx, column=4).fill = card_fill
-            ws.cell(row=idx, column=4).border = thin_border
-            
-            ws.row_dimensions[idx].height = 26
-        
-        veh_end_row = veh_start_row + 5
-        
-        doughnut1 = DoughnutChart()
-        doughnut1.title = "حالة الأسطول"
-        labels2 = Reference(ws, min_col=1, min_row=veh_start_row+2, max_row=veh_end_row)
-        data2 = Reference(ws, min_col=2, min_row=veh_start_row+1, max_row=veh_end_row)
-        doughnut1.add_data(data2, titles_from_data=True)
-        doughnut1.set_categories(labels2)
-        doughnut1.width = 10
-        doughnut1.height = 7
-        doughnut1.dataLabels = DataLabelList()
-        doughnut1.dataLabels.showPercent = True
-        ws.add_chart(doughnut1, f"F{veh_start_row}")
-        
-        # === قسم الأقسام === (يبدأ بعد قسم السيارات مع مسافة)
-        departments = Department.query.all()
-        
-        dept_start_row = veh_end_row + 10
-        ws.merge_cells(f'A{dept_start_row}:E{dept_start_row}')
-        ws[f'A{dept_start_row}'] = "🏢 نسبة الحضور حسب القسم - الموظفين النشطين"
-        ws[f'A{dept_start_row}'].font = section_font
-        ws[f'A{dept_start_row}'].fill = header_fill
-        ws[f'A{dept_start_row}'].alignment = Alignment(horizontal='center', vertical='center')
-        ws[f'A{dept_start_row}'].border = accent_border
-        ws.row_dimensions[dept_start_row].height = 35
-        
-        dept_headers = ['القسم', 'الموظفين', 'الحضور', 'النسبة', 'التقييم']
-        for i, h in enumerate(dept_headers):
-            cell = ws.cell(row=dept_start_row+1, column=i+1)
-            cell.value = h
-            cell.font = cyan_font
-            cell.fill = card_fill_alt
-            cell.alignment = Alignment(horizontal='center', vertical='center')
-            cell.border = cyan_border_thin
-        ws.row_dimensions[dept_start_row+1].height = 28
-        
-        dept_row = dept_start_row + 2
-        for dept in departments[:10]:
-            # جلب موظفي القسم النشطين فقط
-            emp_ids = db.session.query(Employee.id).join(
-                Employee.departments
-            ).filter(
-                Department.id == dept.id,
-                Employee.status == 'active'
-            ).all()
-            emp_ids = [e[0] for e in emp_ids]
-            
-            if not emp_ids:
-                continue
-            
-            # الموظفين الذين لهم حضور فعلي في الفترة
-            emp_ids_with_attendance = db.session.query(Attendance.employee_id).filter(
-                Attendance.date >= d_from,
-                Attendance.date <= d_to,
-                Attendance.employee_id.in_(emp_ids)
-            ).distinct().all()
-            emp_ids_with_attendance = [e[0] for e in emp_ids_with_attendance]
-            
-            if not emp_ids_with_attendance:
-                continue
-            
-            dept_attendance = Attendance.query.filter(
-                Attendance.date >= d_from,
-                Attendance.date <= d_to,
-                Attendance.employee_id.in_(emp_ids_with_attendance)
-            ).all()
-            
-            present = sum(1 for a in dept_attendance if a.status == 'present')
-            total = len(dept_attendance)
-            rate = round((present / total) * 100) if total > 0 else 0
-            
-            if rate >= 90:
-                rating = "ممتاز ⭐"
-                rating_fill = green_fill
-            elif rate >= 75:
-                rating = "جيد 👍"
-                rating_fill = teal_fill
-            elif rate >= 60:
-                rating = "متوسط ⚡"
-                rating_fill = orange_fill
-            else:
-                rating = "يحتاج تحسين ⚠️"
-                rating_fill = red_fill
-            
-            ws.cell(row=dept_row, column=1).value = dept.name
-            ws.cell(row=dept_row, column=1).font = data_font
-            ws.cell(row=dept_row, column=1).fill = card_fill
-            ws.cell(row=dept_row, column=1).alignment = Alignment(horizontal='center', vertical='center')
-            ws.cell(row=dept_row, column=1).border = thin_border
-            
-            ws.cell(row=dept_row, column=2).value = len(emp_ids_with_attendance)
-            ws.cell(row=dept_row, column=2).font = Font(bold=True, color="00D4FF", size=12, name='Arial')
-            ws.cell(row=dept_row, column=2).fill = card_fill
-            ws.cell(row=dept_row, column=2).alignment = Alignment(horizontal='center', vertical='center')
-            ws.cell(row=dept_row, column=2).border = thin_border
-            
-            ws.cell(row=dept_row, column=3).value = present
-            ws.cell(row=dept_row, column=3).font = Font(bold=True, color="00F5D4", size=12, name='Arial')
-            ws.cell(row=dept_row, column=3).fill = card_fill
-            ws.cell(row=dept_row, column=3).alignment = Alignment(horizontal='center', vertical='center')
-            ws.cell(row=dept_row, column=3).border = thin_border
-            
-            ws.cell(row=dept_row, column=4).value = f"{rate}%"
-            ws.cell(row=dept_row, column=4).font = Font(bold=True, color="FFFFFF", size=12, name='Arial')
-            ws.cell(row=dept_row, column=4).fill = card_fill
-            ws.cell(row=dept_row, column=4).alignment = Alignment(horizontal='center', vertical='center')
-            ws.cell(row=dept_row, column=4).border = thin_border
-            
-            ws.cell(row=dept_row, column=5).value = rating
-            ws.cell(row=dept_row, column=5).font = dark_font
-            ws.cell(row=dept_row, column=5).fill = rating_fill
-            ws.cell(row=dept_row, column=5).alignment = Alignment(horizontal='center', vertical='center')
-            ws.cell(row=dept_row, column=5).border = thin_border
-            
-            ws.row_dimensions[dept_row].height = 26
-            dept_row += 1
-        
-        if dept_row > dept_start_row + 2:
-            bar1 = BarChart()
-            bar1.type = "col"
-            bar1.style = 12
-            bar1.title = "نسبة الحضور بالأقسام"
-            bar1.y_axis.title = "النسبة %"
-            
-            data_bar = Reference(ws, min_col=4, min_row=dept_start_row+1, max_row=dept_row-1)
-            cats_bar = Reference(ws, min_col=1, min_row=dept_start_row+2, max_row=dept_row-1)
-            bar1.add_data(data_bar, titles_from_data=True)
-            bar1.set_categories(cats_bar)
-            bar1.width = 10
-            bar1.height = 7
-            bar1.dataLabels = DataLabelList()
-            bar1.dataLabels.showVal = True
-            ws.add_chart(bar1, f"G{dept_start_row}")
-        
-        # === قسم الوثائق === (يبدأ بعد الأقسام مع مسافة كافية للرسم)
-        doc_counts = db.session.query(
-            Document.employee_id,
-            func.count(Document.id)
-        ).group_by(Document.employee_id).all()
-        
-        complete_docs = sum(1 for _, cnt in doc_counts if cnt >= 4)
-        incomplete_docs = max(0, total_employees - complete_docs)
-        
-        doc_start = dept_row + 10
-        ws.merge_cells(f'A{doc_start}:E{doc_start}')
-        ws[f'A{doc_start}'] = "📄 حالة اكتمال الوثائق - الموظفين النشطين"
-        ws[f'A{doc_start}'].font = section_font
-        ws[f'A{doc_start}'].fill = header_fill
-        ws[f'A{doc_start}'].alignment = Alignment(horizontal='center', vertical='center')
-        ws[f'A{doc_start}'].border = accent_border
-        ws.row_dimensions[doc_start].height = 35
-        
-        doc_headers = ['الحالة', 'العدد', 'النسبة', 'الرسم البياني']
-        for i, h in enumerate(doc_headers, 1):
-            ws.cell(row=doc_start+1, column=i).value = h
-            ws.cell(row=doc_start+1, column=i).font = cyan_font
-            ws.cell(row=doc_start+1, column=i).fill = card_fill_alt
-            ws.cell(row=doc_start+1, column=i).alignment = Alignment(horizontal='center', vertical='center')
-            ws.cell(row=doc_start+1, column=i).border = cyan_border_thin
-        ws.row_dimensions[doc_start+1].height = 28
-        
-        complete_pct = round((complete_docs / total_employees * 100), 1) if total_employees > 0 else 0
-        incomplete_pct = round((incomplete_docs / total_employees * 100), 1) if total_employees > 0 else 0
-        
-        ws.cell(row=doc_start+2, column=1).value = "مكتمل ✅"
-        ws.cell(row=doc_start+2, column=2).value = complete_docs
-        ws.cell(row=doc_start+2, column=3).value = f"{complete_pct}%"
-        bar_width = int(complete_pct / 4) if complete_pct > 0 else 1
-        ws.cell(row=doc_start+2, column=4).value = "█" * bar_width
-        ws.cell(row=doc_start+2, column=1).font = white_font
-        ws.cell(row=doc_start+2, column=2).font = Font(bold=True, color="00D4FF", size=14, name='Arial')
-        ws.cell(row=doc_start+2, column=3).font = Font(bold=True, color="00F5D4", size=12, name='Arial')
-        ws.cell(row=doc_start+2, column=4).font = Font(color="10B981", size=12, name='Arial')
-        for i in range(1, 5):
-            ws.cell(row=doc_start+2, column=i).fill = card_fill
-            ws.cell(row=doc_start+2, column=i).border = thin_border
-            ws.cell(row=doc_start+2, column=i).alignment = Alignment(horizontal='center', vertical='center')
-        ws.row_dimensions[doc_start+2].height = 26
-        
-        ws.cell(row=doc_start+3, column=1).value = "ناقص ⚠️"
-        ws.cell(row=doc_start+3, column=2).value = incomplete_docs
-        ws.cell(row=doc_start+3, column=3).value = f"{incomplete_pct}%"
-        bar_width = int(incomplete_pct / 4) if incomplete_pct > 0 else 1
-        ws.cell(row=doc_start+3, column=4).value = "█" * bar_width
-        ws.cell(row=doc_start+3, column=1).font = white_font
-        ws.cell(row=doc_start+3, column=2).font = Font(bold=True, color="00D4FF", size=14, name='Arial')
-        ws.cell(row=doc_start+3, column=3).font = Font(bold=True, color="FFD700", size=12, name='Arial')
-        ws.cell(row=doc_start+3, column=4).font = Font(color="FF4757", size=12, name='Arial')
-        for i in range(1, 5):
-            ws.cell(row=doc_start+3, column=i).fill = card_fill
-            ws.cell(row=doc_start+3, column=i).border = thin_border
-            ws.cell(row=doc_start+3, column=i).alignment = Alignment(horizontal='center', vertical='center')
-        ws.row_dimensions[doc_start+3].height = 26
-        
-        pie3 = PieChart()
-        pie3.title = "اكتمال الوثائق"
-        labels3 = Reference(ws, min_col=1, min_row=doc_start+2, max_row=doc_start+3)
-        data3 = Reference(ws, min_col=2, min_row=doc_start+1, max_row=doc_start+3)
-        pie3.add_data(data3, titles_from_data=True)
-        pie3.set_categories(labels3)
-        pie3.width = 10
-        pie3.height = 7
-        pie3.dataLabels = DataLabelList()
-        pie3.dataLabels.showPercent = True
-        ws.add_chart(pie3, f"G{doc_start}")
-        
-        # ألوان للتقارير التفصيلية
-        detail_header_fill = PatternFill(start_color="1F2937", end_color="1F2937", fill_type="solid")
-        detail_header_font = Font(bold=True, color="00D4AA", size=12)
-        success_fill = PatternFill(start_color="D1FAE5", end_color="D1FAE5", fill_type="solid")
-        warning_fill = PatternFill(start_color="FEF3C7", end_color="FEF3C7", fill_type="solid")
-        danger_fill = PatternFill(start_color="FEE2E2", end_color="FEE2E2", fill_type="solid")
-        info_fill = PatternFill(start_color="DBEAFE", end_color="DBEAFE", fill_type="solid")
-        alt_row_fill = PatternFill(start_color="F3F4F6", end_color="F3F4F6", fill_type="solid")
-        
-        if data_type in ['attendance', 'all']:
-            ws_att = wb.create_sheet("تقرير الحضور")
-            ws_att.sheet_view.rightToLeft = True
-            
-            ws_att.merge_cells('A1:G1')
-            ws_att['A1'] = "📋 تقرير الحضور التفصيلي - الموظفين النشطين"
-            ws_att['A1'].font = title_font
-            ws_att['A1'].alignment = Alignment(horizontal='center', vertical='center')
-            ws_att.row_dimensions[1].height = 30
-            
-            ws_att.merge_cells('A2:G2')
-            ws_att['A2'] = f"الفترة: {d_from} إلى {d_to}"
-            ws_att['A2'].font = subtitle_font
-            ws_att['A2'].alignment = Alignment(horizontal='center', vertical='center')
-            
-            headers = ['التاريخ', 'اسم الموظف', 'الرقم الوظيفي', 'القسم', 'الحالة', 'وقت الحضور', 'وقت الانصراف']
-            for col, header in enumerate(headers, start=1):
-                cell = ws_att.cell(row=4, column=col)
-                cell.value = header
-                cell.font = detail_header_font
-                cell.fill = detail_header_fill
-                cell.border = thin_border
-                cell.alignment = Alignment(horizontal='center', vertical='center')
-            ws_att.row_dimensions[4].height = 25
-            
-            # جلب الحضور للموظفين النشطين فقط
-            query = Attendance.query.filter(
-                Attendance.employee_id.in_(active_emp_ids)
-            ).order_by(Attendance.date.desc())
-            query = query.filter(Attendance.date >= d_from, Attendance.date <= d_to)
-            
-            status_translations = {
-                'present': 'حاضر',
-                'absent': 'غائب',
-                'late': 'متأخر',
-                'excused': 'معذور',
-                'leave': 'إجازة',
-                'sick': 'مريض'
-            }
-            
-            att_records = query.limit(500).all()
-            for row_idx, record in enumerate(att_records, start=5):
-                emp = Employee.query.get(record.employee_id) if record.employee_id else None
-                status = record.status or 'unknown'
-                
-                data_row = [
-                    record.date.strftime('%Y-%m-%d') if record.date else '',
-                    emp.name if emp else 'غير معروف',
-                    emp.employee_id if emp else '',
-                    emp.department.name if emp and emp.department else '',
-                    status_translations.get(status, status),
-                    record.time.strftime('%H:%M') if hasattr(record, 'time') and record.time else '',
-                    record.checkout_time.strftime('%H:%M') if hasattr(record, 'checkout_time') and record.checkout_time else ''
-                ]
-                
-                for col, value in enumerate(data_row, start=1):
-                    cell = ws_att.cell(row=row_idx, column=col)
-                    cell.value = value
-                    cell.border = thin_border
-                    cell.alignment = Alignment(horizontal='center')
-                    
-                    if col == 5:
-                        if status == 'present':
-                            cell.fill = success_fill
-                        elif status == 'absent':
-                            cell.fill = danger_fill
-                        elif status == 'late':
-                            cell.fill = warning_fill
-                        elif status == 'excused':
-                            cell.fill = info_fill
-                    elif row_idx % 2 == 0:
-                        cell.fill = alt_row_fill
-            
-            for col in range(1, 8):
-                ws_att.column_dimensions[get_column_letter(col)].width = 18
-        
-        if data_type in ['employees', 'all']:
-            ws_emp = wb.create_sheet("تقرير الموظفين")
-            ws_emp.sheet_view.rightToLeft = True
-            
-            ws_emp.merge_cells('A1:F1')
-            ws_emp['A1'] = "👥 تقرير الموظفين والوثائق"
-            ws_emp['A1'].font = title_font
-            ws_emp['A1'].alignment = Alignment(horizontal='center', vertical='center')
-            ws_emp.row_dimensions[1].height = 30
-            
-            headers = ['الرقم', 'اسم الموظف', 'الرقم الوظيفي', 'القسم', 'عدد الوثائق', 'حالة الوثائق']
-            for col, header in enumerate(headers, start=1):
-                cell = ws_emp.cell(row=3, column=col)
-                cell.value = header
-                cell.font = detail_header_font
-                cell.fill = header_fill
-                cell.border = thin_border
-                cell.alignment = Alignment(horizontal='center', vertical='center')
-            ws_emp.row_dimensions[3].height = 25
-            
-            employees = Employee.query.all()
-            
-            doc_counts = db.session.query(
-                Document.employee_id,
-                func.count(Document.id).label('count')
-            ).group_by(Document.employee_id).all()
-            doc_count_map = {e_id: cnt for e_id, cnt in doc_counts}
-            
-            for row_idx, emp in enumerate(employees, start=4):
-                docs_count = doc_count_map.get(emp.id, 0)
-                status = 'مكتمل ✅' if docs_count >= 4 else 'ناقص ⚠️'
-                
-                data_row = [
-                    emp.id,
-                    emp.name,
-                    emp.employee_id or '-',
-                    emp.department.name if emp.department else 'بدون قسم',
-                    docs_count,
-                    status
-                ]
-                
-                for col, value in enumerate(data_row, start=1):
-                    cell = ws_emp.cell(row=row_idx, column=col)
-                    cell.value = value
-                    cell.border = thin_border
-                    cell.alignment = Alignment(horizontal='center')
-                    
-                    if col == 6:
-                        cell.fill = success_fill if docs_count >= 4 else warning_fill
-                    elif row_idx % 2 == 0:
-                        cell.fill = alt_row_fill
-            
-            for col in range(1, 7):
-                ws_emp.column_dimensions[get_column_letter(col)].width = 18
-        
-        if data_type in ['vehicles', 'all']:
-            ws_veh = wb.create_sheet("تقرير السيارات")
-            ws_veh.sheet_view.rightToLeft = True
-            
-            ws_veh.merge_cells('A1:F1')
-            ws_veh['A1'] = "🚗 تقرير أسطول السيارات"
-            ws_veh['A1'].font = title_font
-            ws_veh['A1'].alignment = Alignment(horizontal='center', vertical='center')
-            ws_veh.row_dimensions[1].height = 30
-            
-            headers = ['رقم اللوحة', 'الماركة', 'الموديل', 'السنة', 'الحالة', 'حالة التسليم']
-            for col, header in enumerate(headers, start=1):
-                cell = ws_veh.cell(row=3, column=col)
-                cell.value = header
-                cell.font = detail_header_font
-                cell.fill = header_fill
-                cell.border = thin_border
-                cell.alignment = Alignment(horizontal='center', vertical='center')
-            ws_veh.row_dimensions[3].height = 25
-            
-            status_translations = {
-                'working': 'نشط',
-                'maintenance': 'صيانة',
-                'inactive': 'غير نشط'
-            }
-            
-            vehicles = Vehicle.query.all()
-            for row_idx, v in enumerate(vehicles, start=4):
-                status = v.status or 'unknown'
-                
-                data_row = [
-                    v.plate_number if hasattr(v, 'plate_number') else '',
-                    v.make if hasattr(v, 'make') else '',
-                    v.model if hasattr(v, 'model') else '',
-                    v.year if hasattr(v, 'year') else '',
-                    status_translations.get(status, status),
-                    'مستلمة ✅' if v.handover_records else 'غير مستلمة'
-                ]
-                
-                for col, value in enumerate(data_row, start=1):
-                    cell = ws_veh.cell(row=row_idx, column=col)
-                    cell.value = value
-                    cell.border = thin_border
-                    cell.alignment = Alignment(horizontal='center')
-                    
-                    if col == 5:
-                        if status == 'working':
-                            cell.fill = success_fill
-                        elif status == 'maintenance':
-                            cell.fill = warning_fill
-                        elif status == 'inactive':
-                            cell.fill = danger_fill
-                    elif row_idx % 2 == 0:
-                        cell.fill = alt_row_fill
-            
-            for col in range(1, 7):
-                ws_veh.column_dimensions[get_column_letter(col)].width = 16
-        
-        if data_type == 'all':
-            ws_dept = wb.create_sheet("تحليل الأقسام")
-            ws_dept.sheet_view.rightToLeft = True
-            
-            ws_dept.merge_cells('A1:G1')
-            ws_dept['A1'] = "🏢 تحليل الحضور حسب الأقسام"
-            ws_dept['A1'].font = title_font
-            ws_dept['A1'].alignment = Alignment(horizontal='center', vertical='center')
-            ws_dept.row_dimensions[1].height = 30
-            
-            headers = ['القسم', 'عدد الموظفين', 'حاضر', 'غائب', 'متأخر', 'نسبة الحضور', 'التقييم']
-            for col, header in enumerate(headers, start=1):
-                cell = ws_dept.cell(row=3, column=col)
-                cell.value = header
-                cell.font = detail_header_font
-                cell.fill = header_fill
-                cell.border = thin_border
-                cell.alignment = Alignment(horizontal='center', vertical='center')
-            ws_dept.row_dimensions[3].height = 25
-            
-            if date_from:
-                d_from = datetime.strptime(date_from, '%Y-%m-%d').date()
-            else:
-                d_from = datetime.now().date() - timedelta(days=30)
-            
-            if date_to:
-                d_to = datetime.strptime(date_to, '%Y-%m-%d').date()
-            else:
-                d_to = datetime.now().date()
-            
-            departments = Department.query.all()
-            
-            all_employees = Employee.query.all()
-            dept_employees = {}
-            for e in all_employees:
-                if e.department_id:
-                    if e.department_id not in dept_employees:
-                        dept_employees[e.department_id] = []
-                    dept_employees[e.department_id].append(e.id)
-            
-            all_attendance = Attendance.query.filter(
-                Attendance.date >= d_from,
-                Attendance.date <= d_to
-            ).all()
-            
-            dept_attendance = {}
-            for a in all_attendance:
-                for d_id, emp_ids in dept_employees.items():
-                    if a.employee_id in emp_ids:
-                        if d_id not in dept_attendance:
-                            dept_attendance[d_id] = {'present': 0, 'absent': 0, 'late': 0, 'total': 0}
-                        dept_attendance[d_id]['total'] += 1
-                        if a.status == 'present':
-                            dept_attendance[d_id]['present'] += 1
-                        elif a.status == 'absent':
-                            dept_attendance[d_id]['absent'] += 1
-                        elif a.status == 'late':
-                            dept_attendance[d_id]['late'] += 1
-                        break
-            
-            actual_row = 4
-            for dept in departments:
-                emp_count = len(dept_employees.get(dept.id, []))
-                if emp_count == 0:
-                    continue
-                
-                stats = dept_attendance.get(dept.id, {'present': 0, 'absent': 0, 'late': 0, 'total': 0})
-                present = stats['present']
-                absent = stats['absent']
-                late = stats['late']
-                total = stats['total']
-                rate = round((present / total) * 100, 1) if total > 0 else 0
-                
-                if rate >= 90:
-                    performance = 'ممتاز ⭐'
-                    perf_fill = success_fill
-                elif rate >= 75:
-                    performance = 'جيد 👍'
-                    perf_fill = info_fill
-                elif rate >= 60:
-                    performance = 'متوسط ⚡'
-                    perf_fill = warning_fill
-                else:
-                    performance = 'يحتاج تحسين ⚠️'
-                    perf_fill = danger_fill
-                
-                data_row = [dept.name, len(employees), present, absent, late, f'{rate}%', performance]
-                
-                for col, value in enumerate(data_row, start=1):
-                    cell = ws_dept.cell(row=row_idx, column=col)
-                    cell.value = value
-                    cell.border = thin_border
-                    cell.alignment = Alignment(horizontal='center')
-                    
-                    if col == 7:
-                        cell.fill = perf_fill
-                    elif row_idx % 2 == 0:
-                        cell.fill = alt_row_fill
-            
-            for col in range(1, 8):
-                ws_dept.column_dimensions[get_column_letter(col)].width = 16
-        
-        output = BytesIO()
-        wb.save(output)
-        output.seek(0)
+        # الملف يُبنى مرة واحدة لكل (نوع، فترة، قسم) ويُعاد استخدامه للتنزيلات المتكررة
+        file_path = get_export_file(data_type, d_from, d_to, department_id)
         
         filename = f"powerbi_report_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
         
         return send_file(
-            output,
+            file_path,
             mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
             as_attachment=True,
             download_name=filename
@@ -5,11 +5,7 @@ from werkzeug.utils import secure_filename
 from sqlalchemy import func, or_, and_
 import os
 import uuid
-from PIL import Image
 import pillow_heif
-from openpyxl import Workbook
-from openpyxl.styles import Font, Alignment, PatternFill, Border, Side
-from openpyxl.utils import get_column_letter
 from io import BytesIO
 
 from app import db
@@ -33,6 +29,7 @@ def allowed_file(filename):
 
 def process_and_save_image(file, property_id):
     """معالجة وحفظ الصورة مع دعم HEIC"""
+    from PIL import Image
     try:
         filename = secure_filename(file.filename)
         file_ext = filename.rsplit('.', 1)[1].lower() if '.' in filename else ''
@@ -654,6 +651,8 @@ def manage_furnishing(property_id):
 @login_required
 def export_excel(property_id):
     """تصدير بيانات العقار إلى Excel"""
+    from openpyxl import Workbook
+    from openpyxl.styles import Font, Alignment, PatternFill, Border, Side
     property = RentalProperty.query.get_or_404(property_id)
     
     # جلب البيانات المرتبطة
@@ -978,6 +977,8 @@ def export_excel(property_id):
 @login_required
 def export_residents_excel(property_id):
     """تصدير بيانات الموظفين القاطنين إلى Excel"""
+    from openpyxl import Workbook
+    from openpyxl.styles import Font, Alignment, PatternFill, Border, Side
     property = RentalProperty.query.get_or_404(property_id)
     
     # جلب الموظفين القاطنين
@@ -1150,6 +1151,9 @@ def export_residents_excel(property_id):
 @login_required
 def export_all_properties_excel():
     """تصدير جميع بيانات العقارات إلى Excel"""
+    from openpyxl import Workbook
+    from openpyxl.styles import Font, Alignment, PatternFill, Border, Side
+    from openpyxl.utils import get_column_letter
     
     # جلب جميع العقارات النشطة
     properties = RentalProperty.query.filter_by(is_active=True).order_by(
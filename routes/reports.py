@@ -3,27 +3,14 @@ from flask_login import login_required
 from sqlalchemy import func, or_
 from datetime import datetime, date, timedelta
 from io import BytesIO
-from utils.pdf import create_pdf, arabic_text, create_data_table, get_styles
-from app import db
-from models import Department, Employee, Attendance, Salary, Document, SystemAudit, Vehicle, Fee, VehicleChecklist, VehicleDamageMarker, VehicleChecklistImage, employee_departments
+from models import Department, Employee, Salary, SystemAudit, Vehicle, Fee, VehicleChecklist, VehicleDamageMarker, VehicleChecklistImage, employee_departments
 from utils.date_converter import parse_date, format_date_hijri, format_date_gregorian, get_month_name_ar
 from utils.excel import generate_employee_excel, generate_salary_excel
-from utils.vehicles_export import export_vehicle_pdf, export_vehicle_excel
-from utils.pdf_generator import generate_salary_report_pdf
-from utils.vehicle_checklist_pdf import create_vehicle_checklist_pdf
 # إضافة الاستيرادات المفقودة
-import arabic_reshaper
-from bidi.algorithm import get_display
-from reportlab.lib import colors
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import A4, landscape
-from reportlab.lib.units import cm
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.ttfonts import TTFont
-import pandas as pd
-from utils.salary_report_pdf import generate_salary_report_pdf
+from utils.lazy_imports import lazy_import
+arabic_reshaper = lazy_import('arabic_reshaper')
+pd = lazy_import('pandas')
+from services import report_datasets
 
 
 reports_bp = Blueprint('reports', __name__, url_prefix='/reports')
@@ -59,6 +46,7 @@ def vehicle_checklist_pdf(checklist_id):
     تصدير تقرير فحص المركبة إلى PDF مع عرض علامات التلف
     :param checklist_id: معرف سجل الفحص
     """
+    from utils.vehicle_checklist_pdf import create_vehicle_checklist_pdf
     try:
         # الحصول على بيانات الفحص
         checklist = VehicleChecklist.query.get_or_404(checklist_id)
@@ -158,6 +146,7 @@ def export_employees_report(export_type):
 @login_required
 def vehicles_pdf():
     """تصدير تقرير المركبات إلى PDF"""
+    from utils.vehicles_export import export_vehicle_pdf
     # الحصول على معلمات الفلتر
     vehicle_type = request.args.get('vehicle_type', '')
     status = request.args.get('status', '')
@@ -269,6 +258,11 @@ def vehicles_excel():
 @login_required
 def fees_pdf():
     """تصدير تقرير الرسوم إلى PDF"""
+    from utils.pdf import arabic_text, register_font
+    from reportlab.lib import colors
+    from reportlab.lib.pagesizes import A4
+    from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
+    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
     # الحصول على معلمات الفلتر
     fee_type = request.args.get('fee_type', '')
     date_from = request.args.get('date_from', '')
@@ -314,8 +308,8 @@ def fees_pdf():
     styles.add(ParagraphStyle(name='ArabicSubTitle', fontName='Amiri-Bold', fontSize=14, alignment=1))
     
     # تسجيل الخطوط
-    pdfmetrics.registerFont(TTFont('Amiri', 'static/fonts/Amiri-Regular.ttf'))
-    pdfmetrics.registerFont(TTFont('Amiri-Bold', 'static/fonts/Amiri-Bold.ttf'))
+    register_font('Amiri', 'static/fonts/Amiri-Regular.ttf')
+    register_font('Amiri-Bold', 'static/fonts/Amiri-Bold.ttf')
     
     # إعداد المحتوى
     content = []
@@ -579,15 +573,7 @@ def employees_report():
     department_id = request.args.get('department_id', '')
     status = request.args.get('status', '')
     
-    query = Employee.query
-    
-    # تطبيق الفلاتر
-    if department_id:
-        query = query.filter_by(department_id=department_id)
-    if status:
-        query = query.filter_by(status=status)
-    
-    employees = query.all()
+    employees = report_datasets.employees(department_id, status).rows('employee')
     departments = Department.query.all()
     
     return render_template('reports/employees.html', 
@@ -602,18 +588,14 @@ def employees_pdf():
     department_id = request.args.get('department_id', '')
     status = request.args.get('status', '')
     
-    query = Employee.query
+    dataset = report_datasets.employees(department_id, status)
     
-    # تطبيق الفلاتر
     if department_id:
-        query = query.filter_by(department_id=department_id)
-        department = Department.query.get(department_id)
-        department_name = department.name if department else ""
+        department_name = dataset.meta['department_name'] or ""
     else:
         department_name = "جميع الأقسام"
     
     if status:
-        query = query.filter_by(status=status)
         if status == 'active':
             status_name = "نشط"
         elif status == 'inactive':
@@ -625,7 +607,7 @@ def employees_pdf():
     else:
         status_name = "جميع الحالات"
     
-    employees = query.all()
+    employees = dataset.rows('employee')
     
     # استخدام المكتبة الموحدة لإنشاء PDF
     from utils.pdf import arabic_text, create_pdf, create_data_table, get_styles
@@ -700,15 +682,7 @@ def employees_excel():
     department_id = request.args.get('department_id', '')
     status = request.args.get('status', '')
     
-    query = Employee.query
-    
-    # تطبيق الفلاتر
-    if department_id:
-        query = query.filter_by(department_id=department_id)
-    if status:
-        query = query.filter_by(status=status)
-    
-    employees = query.all()
+    employees = report_datasets.employees(department_id, status).rows('employee')
     
     # توليد ملف Excel
     output = generate_employee_excel(employees)
@@ -738,23 +712,9 @@ def attendance_report():
         from_date = datetime.now() - timedelta(days=7)
         to_date = datetime.now()
     
-    # استعلام الحضور
-    query = db.session.query(
-            Attendance, Employee
-        ).join(
-            Employee, Attendance.employee_id == Employee.id
-        ).filter(
-            Attendance.date.between(from_date, to_date)
-        )
-    
-    # تطبيق الفلاتر
-    if department_id:
-        query = query.filter(Employee.department_id == department_id)
-    if status:
-        query = query.filter(Attendance.status == status)
-    
-    # الحصول على النتائج النهائية
-    results = query.order_by(Attendance.date.desc()).all()
+    # سجلات الحضور (مشتركة مع تصدير PDF و Excel)
+    dataset = report_datasets.attendance(from_date, to_date, department_id)
+    results = dataset.rows('attendance', 'employee', mask=dataset.mask('attendance.status', status))
     
     # الحصول على قائمة الأقسام لعناصر الفلتر
     departments = Department.query.all()
@@ -772,6 +732,13 @@ def attendance_report():
 @reports_bp.route('/attendance/pdf')
 def attendance_pdf():
     """تصدير تقرير الحضور إلى PDF"""
+    from utils.pdf import register_font
+    from bidi.algorithm import get_display
+    from reportlab.lib import colors
+    from reportlab.lib.pagesizes import A4, landscape
+    from reportlab.lib.units import cm
+    from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
+    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
     # الحصول على معلمات الفلتر
     from_date_str = request.args.get('from_date', (datetime.now() - timedelta(days=7)).strftime('%Y-%m-%d'))
     to_date_str = request.args.get('to_date', datetime.now().strftime('%Y-%m-%d'))
@@ -786,25 +753,15 @@ def attendance_pdf():
         from_date = datetime.now() - timedelta(days=7)
         to_date = datetime.now()
     
-    # استعلام الحضور
-    query = db.session.query(
-            Attendance, Employee
-        ).join(
-            Employee, Attendance.employee_id == Employee.id
-        ).filter(
-            Attendance.date.between(from_date, to_date)
-        )
+    # سجلات الحضور (مشتركة مع صفحة التقرير وتصدير Excel)
+    dataset = report_datasets.attendance(from_date, to_date, department_id)
     
-    # تطبيق الفلاتر
     if department_id:
-        query = query.filter(Employee.department_id == department_id)
-        department = Department.query.get(department_id)
-        department_name = department.name if department else ""
+        department_name = dataset.meta['department_name'] or ""
     else:
         department_name = "جميع الأقسام"
     
     if status:
-        query = query.filter(Attendance.status == status)
         if status == 'present':
             status_name = "حاضر"
         elif status == 'absent':
@@ -819,7 +776,7 @@ def attendance_pdf():
         status_name = "جميع الحالات"
     
     # الحصول على النتائج النهائية
-    results = query.order_by(Attendance.date.desc()).all()
+    results = dataset.rows('attendance', 'employee', mask=dataset.mask('attendance.status', status))
     
     # إنشاء ملف PDF
     buffer = BytesIO()
@@ -827,7 +784,7 @@ def attendance_pdf():
     # تسجيل الخط العربي
     try:
         # محاولة تسجيل الخط العربي إذا لم يكن مسجلاً مسبقًا
-        pdfmetrics.registerFont(TTFont('Arabic', 'static/fonts/Arial.ttf'))
+        register_font('Arabic', 'static/fonts/Arial.ttf')
     except:
         # إذا كان هناك خطأ، نستخدم الخط الافتراضي
         pass
@@ -997,92 +954,16 @@ def attendance_excel():
     # ===== 1. صفحة Dashboard الرئيسية =====
     ws_dashboard = wb.create_sheet("📊 لوحة المعلومات", 0)
     
-    # جلب البيانات لجميع الأقسام
-    departments = Department.query.all() if not department_id else [Department.query.get(department_id)]
+    # ملخص الأقسام من بيانات التقرير المشتركة (بدون استعلام لكل قسم أو موظف)
+    dataset = report_datasets.attendance(from_date, to_date, department_id)
+    department_stats = [dept for dept in dataset.meta['departments'] if dept['employees']]
+    attendance_days = dataset.meta['days']
     
     # جمع إحصائيات عامة
-    total_employees = 0
-    total_present = 0
-    total_absent = 0
-    total_leave = 0
-    total_sick = 0
-    total_records = 0
-    
-    department_stats = []
-    
-    for dept in departments:
-        if not dept:
-            continue
-        
-        # جلب موظفي القسم عبر العلاقة الصحيحة (استبعاد المنتهية خدمتهم فقط)
-        employees = [emp for emp in dept.employees if emp.status not in ['terminated', 'inactive']]
-        dept_employee_count = len(employees)
-        
-        if dept_employee_count == 0:
-            continue
-        
-        employee_ids = [emp.id for emp in employees]
-        
-        # جلب سجلات الحضور
-        attendance_records = Attendance.query.filter(
-            Attendance.employee_id.in_(employee_ids),
-            Attendance.date >= from_date,
-            Attendance.date <= to_date
-        ).all()
-        
-        # حساب الإحصائيات
-        present_count = sum(1 for r in attendance_records if r.status == 'present')
-        absent_count = sum(1 for r in attendance_records if r.status == 'absent')
-        leave_count = sum(1 for r in attendance_records if r.status == 'leave')
-        sick_count = sum(1 for r in attendance_records if r.status == 'sick')
-        dept_total = len(attendance_records)
-        
-        attendance_rate = (present_count / dept_total * 100) if dept_total > 0 else 0
-        
-        # جمع أسماء الغائبين والإجازات
-        absentees = []
-        on_leave = []
-        sick_list = []
-        
-        for record in attendance_records:
-            employee = next((e for e in employees if e.id == record.employee_id), None)
-            if not employee:
-                continue
-            
-            emp_data = {
-                'name': employee.name,
-                'employee_id': employee.employee_id,
-                'date': record.date,
-                'notes': record.notes
-            }
-            
-            if record.status == 'absent':
-                absentees.append(emp_data)
-            elif record.status == 'leave':
-                on_leave.append(emp_data)
-            elif record.status == 'sick':
-                sick_list.append(emp_data)
-        
-        department_stats.append({
-            'name': dept.name,
-            'employees': dept_employee_count,
-            'present': present_count,
-            'absent': absent_count,
-            'leave': leave_count,
-            'sick': sick_count,
-            'total': dept_total,
-            'rate': round(attendance_rate, 1),
-            'absentees': absentees,
-            'on_leave': on_leave,
-            'sick_list': sick_list
-        })
-        
-        total_employees += dept_employee_count
-        total_present += present_count
-        total_absent += absent_count
-        total_leave += leave_count
-        total_sick += sick_count
-        total_records += dept_total
+    total_employees = sum(dept['employees'] for dept in department_stats)
+    total_present = sum(dept['present'] for dept in department_stats)
+    total_absent = sum(dept['absent'] for dept in department_stats)
+    total_leave = sum(dept['leave'] for dept in department_stats)
     
     # تنسيقات عامة
     thick_border = Border(
@@ -1296,23 +1177,15 @@ def attendance_excel():
     
     # ===== صفحة حضور تفصيلية لكل قسم =====
     for dept_data in department_stats:
-        # جلب القسم من قاعدة البيانات
-        dept = Department.query.filter_by(name=dept_data['name']).first()
-        if not dept:
-            continue
-        
-        # جلب جميع موظفي القسم عبر العلاقة الصحيحة (استبعاد المنتهية خدمتهم فقط)
-        employees = [emp for emp in dept.employees if emp.status not in ['terminated', 'inactive']]
-        
-        if not employees:
-            continue
+        # موظفو القسم (غير المنتهية خدمتهم) من بيانات التقرير
+        employees = dept_data['roster']
         
-        ws_dept = wb.create_sheet(f"🏢 {dept.name[:25]}")
+        ws_dept = wb.create_sheet(f"🏢 {dept_data['name'][:25]}")
         
         # العنوان
         total_cols = 9 + len(date_list)
         ws_dept.merge_cells(f'A1:{get_column_letter(total_cols)}3')
-        ws_dept['A1'].value = f"🏢 تقرير حضور قسم {dept.name}\n{from_date.strftime('%Y/%m/%d')} - {to_date.strftime('%Y/%m/%d')}"
+        ws_dept['A1'].value = f"🏢 تقرير حضور قسم {dept_data['name']}\n{from_date.strftime('%Y/%m/%d')} - {to_date.strftime('%Y/%m/%d')}"
         ws_dept['A1'].font = Font(size=18, bold=True, color="FFFFFF")
         ws_dept['A1'].fill = PatternFill(start_color="667eea", end_color="667eea", fill_type="solid")
         ws_dept['A1'].alignment = Alignment(horizontal='center', vertical='center', wrap_text=True)
@@ -1374,15 +1247,8 @@ def attendance_excel():
             ws_dept.cell(row=emp_idx, column=6).value = employee.location or '-'
             ws_dept.cell(row=emp_idx, column=7).value = employee.project or '-'
             
-            # جلب سجلات الحضور لهذا الموظف
-            attendance_records = Attendance.query.filter(
-                Attendance.employee_id == employee.id,
-                Attendance.date >= from_date,
-                Attendance.date <= to_date
-            ).all()
-            
-            # إنشاء dictionary لربط التاريخ بالحالة
-            attendance_dict = {record.date: record.status for record in attendance_records}
+            # ربط التاريخ بالحالة لهذا الموظف
+            attendance_dict = attendance_days.get(employee.id, {})
             
             # حساب إجمالي الحضور
             total_present = sum(1 for status in attendance_dict.values() if status == 'present')
@@ -1461,63 +1327,10 @@ def salaries_report():
     year = int(request.args.get('year', current_year))
     department_id = request.args.get('department_id', '')
     
-    # استعلام الرواتب
-    salaries_query = Salary.query.filter_by(
-        month=month,
-        year=year
-    )
-    
-    # الحصول على قائمة الموظفين الذين لديهم رواتب (لعرضها في التقرير)
-    employee_ids_with_salary = [s.employee_id for s in salaries_query.all()]
-    
-    # استعلام لجميع الموظفين (لإظهار الموظفين الذين ليس لديهم رواتب مسجلة)
-    employees_query = Employee.query.filter(Employee.status == 'active')
-    
-    if department_id:
-        employees_query = employees_query.filter_by(department_id=department_id)
-    
-    employees = employees_query.all()
-    
-    # الحصول على الرواتب النهائية مع التفاصيل
-    salaries = []
-    for employee in employees:
-        salary = Salary.query.filter_by(
-            employee_id=employee.id,
-            month=month,
-            year=year
-        ).first()
-        
-        if salary:
-            salaries.append({
-                'id': salary.id,
-                'employee': employee,
-                'basic_salary': salary.basic_salary,
-                'allowances': salary.allowances,
-                'deductions': salary.deductions,
-                'bonus': salary.bonus,
-                'net_salary': salary.net_salary,
-                'has_salary': True
-            })
-        else:
-            salaries.append({
-                'id': None,
-                'employee': employee,
-                'basic_salary': 0,
-                'allowances': 0,
-                'deductions': 0,
-                'bonus': 0,
-                'net_salary': 0,
-                'has_salary': False
-            })
-    
-    # حساب الإجماليات
-    totals = {
-        'basic': sum(s['basic_salary'] for s in salaries if s['has_salary']),
-        'allowances': sum(s['allowances'] for s in salaries if s['has_salary']),
-        'deductions': sum(s['deductions'] for s in salaries if s['has_salary']),
-        'bonus': sum(s['bonus'] for s in salaries if s['has_salary']),
-        'net': sum(s['net_salary'] for s in salaries if s['has_salary'])
-    }
+    # الموظفون النشطون مع رواتب الشهر (يظهر أيضاً من ليس له راتب مسجل)
+    dataset = report_datasets.salaries(month, year, department_id)
+    salaries = report_datasets.salary_items(dataset)
+    totals = dataset.meta['totals']
     
     # الحصول على قائمة الأقسام لعناصر الفلتر
     departments = Department.query.all()
@@ -1546,48 +1359,16 @@ def salaries_pdf():
     year = int(request.args.get('year', current_year))
     department_id = request.args.get('department_id', '')
     
-    # استعلام الموظفين النشطين
-    employees_query = Employee.query.filter(Employee.status == 'active')
+    # بيانات الرواتب المشتركة مع صفحة التقرير وتصدير Excel
+    dataset = report_datasets.salaries(month, year, department_id)
     
-    # تطبيق فلتر القسم إذا كان محددًا
     if department_id:
-        employees_query = employees_query.filter_by(department_id=department_id)
-        department = Department.query.get(department_id)
-        department_name = department.name if department else ""
+        department_name = dataset.meta['department_name'] or ""
     else:
         department_name = "جميع الأقسام"
     
-    employees = employees_query.all()
-    
-    # الحصول على الرواتب النهائية مع التفاصيل
-    salaries = []
-    for employee in employees:
-        salary = Salary.query.filter_by(
-            employee_id=employee.id,
-            month=month,
-            year=year
-        ).first()
-        
-        if salary:
-            salaries.append({
-                'id': salary.id,
-                'employee': employee,
-                'basic_salary': salary.basic_salary,
-                'allowances': salary.allowances,
-                'deductions': salary.deductions,
-                'bonus': salary.bonus,
-                'net_salary': salary.net_salary,
-                'has_salary': True
-            })
-    
-    # حساب الإجماليات
-    totals = {
-        'basic': sum(s['basic_salary'] for s in salaries if s['has_salary']),
-        'allowances': sum(s['allowances'] for s in salaries if s['has_salary']),
-        'deductions': sum(s['deductions'] for s in salaries if s['has_salary']),
-        'bonus': sum(s['bonus'] for s in salaries if s['has_salary']),
-        'net': sum(s['net_salary'] for s in salaries if s['has_salary'])
-    }
+    salaries = report_datasets.salary_items(dataset, only_paid=True)
+    totals = dataset.meta['totals']
     
     # توليد PDF باستخدام وحدة PDF المخصصة
     pdf_file = generate_salary_report_pdf(salaries, month, year, department_name, totals)
@@ -1606,6 +1387,7 @@ def salaries_report_pdf():
     إنشاء تقرير PDF شامل للرواتب بناءً على الفلاتر.
     الفلاتر الممكنة: year, month, department_id
     """
+    from utils.salary_report_pdf import generate_salary_report_pdf
     try:
         year = request.args.get('year', type=int)
         month = request.args.get('month', type=int)
@@ -1678,26 +1460,9 @@ def salaries_excel():
     year = int(request.args.get('year', current_year))
     department_id = request.args.get('department_id', '')
     
-    # استعلام الموظفين النشطين
-    employees_query = Employee.query.filter(Employee.status == 'active')
-    
-    # تطبيق فلتر القسم إذا كان محددًا
-    if department_id:
-        employees_query = employees_query.filter_by(department_id=department_id)
-    
-    employees = employees_query.all()
-    
-    # الحصول على الرواتب النهائية مع التفاصيل
-    salaries = []
-    for employee in employees:
-        salary = Salary.query.filter_by(
-            employee_id=employee.id,
-            month=month,
-            year=year
-        ).first()
-        
-        if salary:
-            salaries.append(salary)
+    # بيانات الرواتب المشتركة مع صفحة التقرير وتصدير PDF
+    dataset = report_datasets.salaries(month, year, department_id)
+    salaries = dataset.rows('salary', 'employee', mask=dataset['salary.has_salary'])
     
     # إنشاء ملف Excel
     import pandas as pd
@@ -1744,8 +1509,7 @@ def salaries_excel():
         cell.border = thin_border
     
     # إضافة البيانات
-    for idx, salary in enumerate(salaries, start=3):
-        employee = salary.employee
+    for idx, (salary, employee) in enumerate(salaries, start=3):
         sheet.cell(row=idx, column=1).value = employee.name
         sheet.cell(row=idx, column=2).value = employee.employee_id
         
@@ -1780,12 +1544,13 @@ def salaries_excel():
     sheet.cell(row=total_row, column=1).font = Font(bold=True, name='Tajawal')
     sheet.merge_cells(f'A{total_row}:C{total_row}')
     
-    # حساب الإجماليات
-    basic_total = sum(s.basic_salary for s in salaries)
-    allowances_total = sum(s.allowances for s in salaries)
-    deductions_total = sum(s.deductions for s in salaries)
-    bonus_total = sum(s.bonus for s in salaries)
-    net_total = sum(s.net_salary for s in salaries)
+    # الإجماليات محسوبة مع بيانات التقرير
+    totals = dataset.meta['totals']
+    basic_total = totals['basic']
+    allowances_total = totals['allowances']
+    deductions_total = totals['deductions']
+    bonus_total = totals['bonus']
+    net_total = totals['net']
     
     sheet.cell(row=total_row, column=4).value = basic_total
     sheet.cell(row=total_row, column=5).value = allowances_total
@@ -1841,26 +1606,9 @@ def documents_report():
     expiring_only = request.args.get('expiring_only', '') == 'true'
     expiry_days = int(request.args.get('expiry_days', 30))
     
-    # تحديد تاريخ الانتهاء للمقارنة في حالة "قريبة من الانتهاء"
-    cutoff_date = datetime.now().date() + timedelta(days=expiry_days)
-    
-    # استعلام الوثائق
-    query = db.session.query(
-            Document, Employee
-        ).join(
-            Employee, Document.employee_id == Employee.id
-        )
-    
-    # تطبيق الفلاتر
-    if department_id:
-        query = query.filter(Employee.department_id == department_id)
-    if document_type:
-        query = query.filter(Document.document_type == document_type)
-    if expiring_only:
-        query = query.filter(Document.expiry_date <= cutoff_date)
-    
-    # الحصول على النتائج النهائية
-    results = query.order_by(Document.expiry_date).all()
+    # الوثائق (مشتركة بين صفحة التقرير وتصديره)
+    dataset = report_datasets.documents(department_id, document_type, expiring_only, expiry_days)
+    results = dataset.rows('document', 'employee')
     
     # الحصول على قائمة الأقسام وأنواع الوثائق لعناصر الفلتر
     departments = Department.query.all()
@@ -1892,26 +1640,16 @@ def documents_pdf():
     expiring_only = request.args.get('expiring_only', '') == 'true'
     expiry_days = int(request.args.get('expiry_days', 30))
     
-    # تحديد تاريخ الانتهاء للمقارنة في حالة "قريبة من الانتهاء"
-    cutoff_date = datetime.now().date() + timedelta(days=expiry_days)
+    # الوثائق (مشتركة بين صفحة التقرير وتصديره)
+    dataset = report_datasets.documents(department_id, document_type, expiring_only, expiry_days)
     
-    # استعلام الوثائق
-    query = db.session.query(
-            Document, Employee
-        ).join(
-            Employee, Document.employee_id == Employee.id
-        )
-    
-    # تطبيق الفلاتر والحصول على أسماء الفلاتر
+    # أسماء الفلاتر
     if department_id:
-        query = query.filter(Employee.department_id == department_id)
-        department = Department.query.get(department_id)
-        department_name = department.name if department else ""
+        department_name = dataset.meta['department_name'] or ""
     else:
         department_name = "جميع الأقسام"
     
     if document_type:
-        query = query.filter(Document.document_type == document_type)
         document_types_map = {
             'national_id': 'الهوية الوطنية',
             'passport': 'جواز السفر',
@@ -1924,13 +1662,12 @@ def documents_pdf():
         document_type_name = "جميع أنواع الوثائق"
     
     if expiring_only:
-        query = query.filter(Document.expiry_date <= cutoff_date)
         expiry_status = f"الوثائق التي ستنتهي خلال {expiry_days} يوم"
     else:
         expiry_status = "جميع الوثائق"
     
     # الحصول على النتائج النهائية
-    results = query.order_by(Document.expiry_date).all()
+    results = dataset.rows('document', 'employee')
     
     # استخدام المكتبة الموحدة لإنشاء PDF
     from utils.pdf import arabic_text, create_pdf, create_data_table, get_styles
@@ -2030,26 +1767,9 @@ def documents_excel():
     expiring_only = request.args.get('expiring_only', '') == 'true'
     expiry_days = int(request.args.get('expiry_days', 30))
     
-    # تحديد تاريخ الانتهاء للمقارنة في حالة "قريبة من الانتهاء"
-    cutoff_date = datetime.now().date() + timedelta(days=expiry_days)
-    
-    # استعلام الوثائق
-    query = db.session.query(
-            Document, Employee
-        ).join(
-            Employee, Document.employee_id == Employee.id
-        )
-    
-    # تطبيق الفلاتر
-    if department_id:
-        query = query.filter(Employee.department_id == department_id)
-    if document_type:
-        query = query.filter(Document.document_type == document_type)
-    if expiring_only:
-        query = query.filter(Document.expiry_date <= cutoff_date)
-    
-    # الحصول على النتائج النهائية
-    results = query.order_by(Document.expiry_date).all()
+    # الوثائق (مشتركة بين صفحة التقرير وتصديره)
+    dataset = report_datasets.documents(department_id, document_type, expiring_only, expiry_days)
+    results = dataset.rows('document', 'employee')
     
     # إنشاء كائن Pandas DataFrame
     import pandas as pd
@@ -1,4 +1,3 @@
-import pandas as pd
 from io import BytesIO
 from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, send_file
 from werkzeug.utils import secure_filename
@@ -12,11 +11,6 @@ from utils.excel import parse_salary_excel, generate_salary_excel, generate_comp
 # from utils.reports import generate_salary_report_pdf
 # from utils.salary_pdf_generator import
 
-from utils.ultra_safe_pdf import create_ultra_safe_salary_pdf
-from utils.salary_pdf_generator import generate_salary_summary_pdf
-from utils.salary_report_pdf import generate_salary_report_pdf
-
-from utils.salary_notification import generate_salary_notification_pdf, generate_batch_salary_notifications
 from utils.whatsapp_notification import (
     send_salary_notification_whatsapp, 
     send_salary_deduction_notification_whatsapp,
@@ -1200,6 +1194,7 @@ def report():
 @salaries_bp.route('/report/pdf')
 def report_pdf():
     """Generate a PDF salary report for a specific month and year"""
+    from utils.salary_pdf_generator import generate_salary_summary_pdf
     try:
         # Get filter parameters
         month = request.args.get('month')
@@ -1249,6 +1244,7 @@ def report_pdf():
 @salaries_bp.route('/notification/<int:id>/pdf')
 def salary_notification_pdf(id):
     """إنشاء إشعار راتب لموظف بصيغة PDF"""
+    from utils.salary_notification import generate_salary_notification_pdf
     try:
         # الحصول على سجل الراتب
         salary = Salary.query.get_or_404(id)
@@ -1756,6 +1752,7 @@ def batch_deduction_notifications():
 @salaries_bp.route('/notifications/batch', methods=['GET', 'POST'])
 def batch_salary_notifications():
     """إنشاء إشعارات رواتب مجمعة للموظفين حسب القسم"""
+    from utils.salary_notification import generate_batch_salary_notifications
     # الحصول على الأقسام للاختيار
     departments = Department.query.all()
     
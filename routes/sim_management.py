@@ -4,7 +4,8 @@ from models import SimCard, ImportedPhoneNumber, Employee, Department, DeviceAss
 from datetime import datetime
 import logging
 from utils.audit_logger import log_activity
-import pandas as pd
+from utils.lazy_imports import lazy_import
+pd = lazy_import('pandas')
 from flask import send_file
 import os
 import tempfile
@@ -5,9 +5,8 @@ from app import db
 from flask_login import current_user, login_required
 from sqlalchemy import or_, and_, func
 from datetime import datetime, timedelta
-import openpyxl
-from openpyxl.styles import Font, Alignment, PatternFill, Border, Side
-import openpyxl.utils
+from utils.lazy_imports import lazy_import
+openpyxl = lazy_import('openpyxl')
 import io
 
 vehicle_operations_bp = Blueprint('vehicle_operations', __name__)
@@ -329,6 +328,7 @@ def test_page():
 @login_required
 def export_vehicle_operations():
     """تصدير عمليات السيارة إلى Excel"""
+    from openpyxl.styles import Font, Alignment, PatternFill, Border, Side
     try:
         # جلب الفلاتر من الطلب
         vehicle_filter = request.args.get('vehicle_filter', '').strip()
@@ -543,6 +543,7 @@ def export_vehicle_operations():
 @vehicle_operations_bp.route('/export')
 def export_simple():
     """تصدير مبسط بدون مصادقة للاختبار"""
+    from openpyxl.styles import Font, Alignment, PatternFill, Border, Side
     try:
         # جلب الفلاتر من الطلب
         vehicle_filter = request.args.get('vehicle_filter', '').strip()
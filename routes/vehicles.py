@@ -10,8 +10,8 @@ import os
 import uuid
 import io
 import urllib.parse
-import pandas as pd
-from fpdf import FPDF
+from utils.lazy_imports import lazy_import
+pd = lazy_import('pandas')
 import base64
 import uuid
 
@@ -26,23 +26,14 @@ from models import (
 )
 from utils.audit_logger import log_activity
 from utils.audit_logger import log_audit
+from utils.image_pipeline import submit_image
+from services.blob_store import BlobStore
+from services import search_index
 from utils.whatsapp_message_generator import generate_whatsapp_url
-from utils.vehicles_export import export_vehicle_pdf, export_workshop_records_pdf, export_vehicle_excel, export_workshop_records_excel
 from utils.vehicle_drive_uploader import VehicleDriveUploader
-from utils.simple_pdf_generator import create_vehicle_handover_pdf as generate_complete_vehicle_report
-from utils.vehicle_excel_report import generate_complete_vehicle_excel_report
-from utils.vehicle_excel_report import generate_complete_vehicle_excel_report
 # from utils.workshop_report import generate_workshop_report_pdf
 # from utils.html_to_pdf import generate_pdf_from_template
 # from utils.fpdf_arabic_report import generate_workshop_report_pdf_fpdf
-from reportlab.lib.pagesizes import A4
-from reportlab.lib import colors
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.ttfonts import TTFont
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle, Image
-import arabic_reshaper
-from bidi.algorithm import get_display
 # from utils.fpdf_handover_pdf import generate_handover_report_pdf
 # ============ تأكد من وجود هذه الاستيرادات في أعلى الملف ============
 from routes.operations import create_operation_request # أو المسار الصحيح للدالة
@@ -53,9 +44,6 @@ from datetime import date
 vehicles_bp = Blueprint('vehicles', __name__)
 
 # استيرادات إضافية لـ Excel
-from openpyxl import Workbook
-from openpyxl.utils.dataframe import dataframe_to_rows
-from openpyxl.styles import Font, PatternFill, Alignment
 
 def update_vehicle_driver(vehicle_id):
         """تحديث اسم السائق في جدول السيارات بناءً على آخر سجل تسليم من نوع delivery"""
@@ -365,42 +353,30 @@ SAFETY_CHECK_STATUS_CHOICES = [
 
 # الوظائف المساعدة
 def save_file(file, folder='vehicles'):
-        """حفظ الملف (صورة أو PDF) في المجلد المحدد وإرجاع المسار ونوع الملف - مع تحقق صارم"""
+        """حفظ الملف (صورة أو PDF) في مخزن الملفات وإرجاع المسار ونوع الملف - مع تحقق صارم
+
+        الملفات تُخزن حسب بصمة محتواها (services/blob_store.py)، لذلك رفع نفس الملف
+        مرة أخرى يعيد نفس المسار بدلاً من نسخة جديدة. المعامل folder محفوظ للتوافق.
+        """
         if not file or not file.filename:
                 return None, None
 
         try:
-                # إنشاء اسم فريد للملف
                 filename = secure_filename(file.filename)
-                unique_filename = f"{uuid.uuid4()}_{filename}"
-
-                # التأكد من وجود المجلد
-                upload_folder = os.path.join(current_app.static_folder, 'uploads', folder)
-                os.makedirs(upload_folder, exist_ok=True)
-
-                # حفظ الملف
-                file_path = os.path.join(upload_folder, unique_filename)
-                file.save(file_path)
+                # الصور تُصغّر قبل حساب البصمة وتُنشأ نسخها المصغرة في الخلفية (للملف الجديد فقط)
+                relative_path, created = BlobStore.save_image(file, filename)
 
                 # ✅ تحقق صارم من نجاح الحفظ
-                if not os.path.exists(file_path):
-                        print(f"❌ الملف غير موجود بعد الحفظ: {file_path}")
-                        return None, None
-                
-                file_size = os.path.getsize(file_path)
-                if file_size == 0:
-                        print(f"❌ الملف فارغ: {file_path}")
-                        # 💾 لا نحذف الملف - نتركه للفحص اليدوي
-                        print(f"💾 الملف الفارغ محفوظ للفحص: {file_path}")
+                if not relative_path:
+                        print(f"❌ الملف فارغ: {filename}")
                         return None, None
 
                 # تحديد نوع الملف (صورة أو PDF)
                 file_type = 'pdf' if filename.lower().endswith('.pdf') else 'image'
 
-                relative_path = f"static/uploads/{folder}/{unique_filename}"
-                print(f"✅ حفظ نجح: {relative_path} ({file_size} bytes)")
+                print(f"✅ حفظ نجح: {relative_path}{'' if created else ' (ملف مكرر)'}")
                 return relative_path, file_type
-                
+
         except Exception as e:
                 print(f"❌ خطأ في حفظ الملف: {str(e)}")
                 import traceback
@@ -468,7 +444,7 @@ def get_filtered_vehicle_documents(document_status='expired', document_type='all
         
         # تطبيق فلاتر البحث النصية
         if plate_number:
-            base_query = base_query.filter(Vehicle.plate_number.ilike(f'%{plate_number}%'))
+            base_query = search_index.filter_query(base_query, 'vehicle', plate_number, keys_only=True, fuzzy=False, order=False)
         
         if vehicle_make:
             base_query = base_query.filter(or_(
@@ -966,9 +942,9 @@ def index():
         if project_filter:
                 query = query.filter(Vehicle.project == project_filter)
 
-        # إضافة البحث برقم السيارة إذا تم تحديده
+        # إضافة البحث برقم السيارة إذا تم تحديده (من فهرس البحث: يطابق اللوحة بأي تباعد أو شكل للحروف والأرقام)
         if search_plate:
-                query = query.filter(Vehicle.plate_number.contains(search_plate))
+                query = search_index.filter_query(query, 'vehicle', search_plate, keys_only=True, order=False)
 
 
         # فلترة المركبات حسب القسم المحدد للمستخدم الحالي
@@ -2786,40 +2762,22 @@ def save_base64_image(base64_string, subfolder):
 
 def save_uploaded_file(file, subfolder):
         """
-        تحفظ ملف مرفوع (من request.files) في مجلد فرعي داخل uploads،
+        تحفظ ملف مرفوع (من request.files) في مخزن الملفات،
         وتُرجع المسار النسبي - مع تحقق صارم من النجاح.
         """
         if not file or not file.filename:
                 return None
 
         try:
-                # إعداد مسار الحفظ
-                upload_folder = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'static', 'uploads', subfolder)
-                os.makedirs(upload_folder, exist_ok=True)
-
-                # الحصول على اسم آمن للملف وإنشاء اسم فريد
                 from werkzeug.utils import secure_filename
-                filename_secure = secure_filename(file.filename)
-                name, ext = os.path.splitext(filename_secure)
-                unique_filename = f"{name}_{uuid.uuid4().hex[:8]}{ext}"
-
-                file_path = os.path.join(upload_folder, unique_filename)
-                file.save(file_path)
+                relative_path, created = BlobStore.save(file, secure_filename(file.filename))
 
                 # ✅ تحقق صارم من نجاح الحفظ
-                if not os.path.exists(file_path):
-                        print(f"❌ الملف غير موجود بعد الحفظ: {file_path}")
-                        return None
-                
-                file_size = os.path.getsize(file_path)
-                if file_size == 0:
-                        print(f"❌ الملف فارغ: {file_path}")
-                        # 💾 لا نحذف الملف - نتركه للفحص اليدوي
-                        print(f"💾 الملف الفارغ محفوظ للفحص: {file_path}")
+                if not relative_path:
+                        print(f"❌ الملف فارغ: {file.filename}")
                         return None
 
-                relative_path = os.path.join('static', 'uploads', subfolder, unique_filename)
-                print(f"✅ حفظ نجح: {relative_path} ({file_size} bytes)")
+                print(f"✅ حفظ نجح: {relative_path}{'' if created else ' (ملف مكرر)'}")
                 return relative_path
 
         except Exception as e:
@@ -4334,14 +4292,7 @@ def detailed_list():
         if year:
                 query = query.filter(Vehicle.year == int(year))
         if search:
-                query = query.filter(
-                        or_(
-                                Vehicle.plate_number.ilike(f'%{search}%'),
-                                Vehicle.make.ilike(f'%{search}%'),
-                                Vehicle.model.ilike(f'%{search}%'),
-                                Vehicle.color.ilike(f'%{search}%')
-                        )
-                )
+                query = search_index.filter_query(query, 'vehicle', search, order=False)
 
         # فلترة حسب المشروع
         if project:
@@ -4550,6 +4501,7 @@ def delete_workshop(id):
 @login_required
 def export_vehicle_to_pdf(id):
         """تصدير بيانات السيارة إلى ملف PDF"""
+        from utils.vehicles_export import export_vehicle_pdf
         vehicle = Vehicle.query.get_or_404(id)
         workshop_records = VehicleWorkshop.query.filter_by(vehicle_id=id).order_by(VehicleWorkshop.entry_date.desc()).all()
         rental_records = VehicleRental.query.filter_by(vehicle_id=id).order_by(VehicleRental.start_date.desc()).all()
@@ -4614,6 +4566,7 @@ def export_workshop_to_pdf(id):
 @login_required
 def export_vehicle_to_excel(id):
         """تصدير بيانات السيارة إلى ملف Excel"""
+        from utils.vehicles_export import export_vehicle_excel
         vehicle = Vehicle.query.get_or_404(id)
         workshop_records = VehicleWorkshop.query.filter_by(vehicle_id=id).order_by(VehicleWorkshop.entry_date.desc()).all()
         rental_records = VehicleRental.query.filter_by(vehicle_id=id).order_by(VehicleRental.start_date.desc()).all()
@@ -4636,6 +4589,7 @@ def export_vehicle_to_excel(id):
 @login_required
 def export_workshop_to_excel(id):
         """تصدير سجلات الورشة للسيارة إلى ملف Excel"""
+        from utils.vehicles_export import export_workshop_records_excel
         vehicle = Vehicle.query.get_or_404(id)
         workshop_records = VehicleWorkshop.query.filter_by(vehicle_id=id).order_by(VehicleWorkshop.entry_date.desc()).all()
 
@@ -4721,6 +4675,7 @@ def print_workshop_records(id):
 @login_required
 def generate_vehicle_report_pdf(id):
         """إنشاء تقرير شامل للسيارة بصيغة PDF"""
+        from utils.simple_pdf_generator import create_vehicle_handover_pdf as generate_complete_vehicle_report
         from flask import send_file, flash, redirect, url_for, make_response
         import io
 
@@ -5147,22 +5102,14 @@ def edit_external_authorization(vehicle_id, auth_id):
             if 'file' in request.files and request.files['file'].filename:
                 file = request.files['file']
                 if file and allowed_file(file.filename):
-                    filename = secure_filename(file.filename)
-                    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-                    filename = f"{timestamp}_{filename}"
-
-                    # إنشاء مجلد الرفع إذا لم يكن موجوداً
-                    upload_dir = os.path.join(current_app.static_folder, 'uploads', 'authorizations')
-                    os.makedirs(upload_dir, exist_ok=True)
-
-                    file_path = os.path.join(upload_dir, filename)
-                    file.save(file_path)
-
-                    # 💾 الملف القديم يبقى محفوظاً - لا نحذف الملفات الفعلية
-                    if auth.file_path:
-                        print(f"💾 الملف القديم محفوظ للأمان: {auth.file_path}")
+                    file_path, _ = BlobStore.save(file, secure_filename(file.filename))
 
-                    auth.file_path = f"static/uploads/authorizations/{filename}"
+                    if file_path:
+                        # 💾 الملف القديم يبقى محفوظاً - لا نحذف الملفات الفعلية
+                        if auth.file_path:
+                            print(f"💾 الملف القديم محفوظ للأمان: {auth.file_path}")
+                            BlobStore.release(auth.file_path)
+                        auth.file_path = file_path
 
             db.session.commit()
             flash('تم تحديث التفويض بنجاح', 'success')
@@ -5241,6 +5188,7 @@ def delete_external_authorization(vehicle_id, auth_id):
 @login_required
 def generate_vehicle_report(id):
         """إنشاء تقرير شامل للسيارة بصيغة Excel"""
+        from utils.vehicle_excel_report import generate_complete_vehicle_excel_report
         from flask import send_file, flash, redirect, url_for, make_response
         import io
 
@@ -5524,20 +5472,8 @@ def vehicle_license_image(vehicle_id):
                 # حفظ الملف
                 file.save(filepath)
 
-                # ضغط الصورة إذا كانت كبيرة
-                try:
-                    from PIL import Image
-                    with Image.open(filepath) as img:
-                        # تحويل إلى RGB إذا كانت الصورة RGBA
-                        if img.mode == 'RGBA':
-                            img = img.convert('RGB')
-
-                        # تصغير الصورة إذا كانت أكبر من 1500x1500
-                        if img.width > 1500 or img.height > 1500:
-                            img.thumbnail((1500, 1500), Image.Resampling.LANCZOS)
-                            img.save(filepath, 'JPEG', quality=85, optimize=True)
-                except Exception as e:
-                    print(f"خطأ في معالجة الصورة: {e}")
+                # ضغط الصورة وإنشاء النسخ المصغرة في الخلفية
+                submit_image(filepath, max_size=1500)
 
                 # تحديث قاعدة البيانات
                 vehicle.license_image = filename
@@ -5703,30 +5639,22 @@ def upload_document(id):
         return redirect(url_for('vehicles.view', id=id))
 
     if file and allowed_file(file.filename):
-        # إنشاء اسم ملف فريد
-        filename = secure_filename(file.filename)
-        unique_filename = f"{uuid.uuid4()}_{filename}"
-
-        # إنشاء المسار المناسب حسب نوع الوثيقة
+        # تحديد الحقل المناسب حسب نوع الوثيقة
         if document_type == 'registration_form':
-            upload_folder = 'static/uploads/vehicles/registration_forms'
             field_name = 'registration_form_image'
         elif document_type == 'plate':
-            upload_folder = 'static/uploads/vehicles/plates'
             field_name = 'plate_image'
         elif document_type == 'insurance':
-            upload_folder = 'static/uploads/vehicles/insurance'
             field_name = 'insurance_file'
         else:
             flash('نوع الوثيقة غير صحيح', 'error')
             return redirect(url_for('vehicles.view', id=id))
 
-        # إنشاء المجلد إذا لم يكن موجوداً
-        os.makedirs(upload_folder, exist_ok=True)
-
-        # حفظ الملف
-        file_path = os.path.join(upload_folder, unique_filename)
-        file.save(file_path)
+        # حفظ الملف في مخزن الملفات (نفس الملف لا يُكرر)
+        file_path, _ = BlobStore.save(file, secure_filename(file.filename))
+        if not file_path:
+            flash('الملف فارغ', 'error')
+            return redirect(url_for('vehicles.view', id=id))
 
         # تحديث قاعدة البيانات
         setattr(vehicle, field_name, file_path)
@@ -6198,7 +6126,7 @@ def valid_documents():
         query = Vehicle.query
         
         if plate_number:
-            query = query.filter(Vehicle.plate_number.ilike(f'%{plate_number}%'))
+            query = search_index.filter_query(query, 'vehicle', plate_number, keys_only=True, fuzzy=False, order=False)
         
         if vehicle_make:
             query = query.filter(or_(
@@ -6273,7 +6201,7 @@ def export_valid_documents_excel():
         query = Vehicle.query
         
         if plate_number:
-            query = query.filter(Vehicle.plate_number.ilike(f'%{plate_number}%'))
+            query = search_index.filter_query(query, 'vehicle', plate_number, keys_only=True, fuzzy=False, order=False)
         
         if vehicle_make:
             query = query.filter(or_(
@@ -9,7 +9,6 @@ import os
 
 from app import db
 from models import Vehicle, VehicleWorkshop, SystemAudit
-from utils.weasyprint_workshop_pdf import generate_workshop_report_pdf
 
 # إنشاء blueprint
 workshop_reports_bp = Blueprint('workshop_reports', __name__, url_prefix='/workshop-reports')
@@ -18,6 +17,7 @@ workshop_reports_bp = Blueprint('workshop_reports', __name__, url_prefix='/works
 @login_required
 def vehicle_workshop_pdf(id):
     """تصدير تقرير سجلات الورشة للمركبة كملف PDF"""
+    from utils.weasyprint_workshop_pdf import generate_workshop_report_pdf
     try:
         # جلب بيانات المركبة
         vehicle = Vehicle.query.get_or_404(id)
@@ -59,6 +59,7 @@ def vehicle_workshop_pdf(id):
 @workshop_reports_bp.route('/vehicle/<int:id>/pdf/public')
 def vehicle_workshop_pdf_public(id):
     """تصدير تقرير سجلات الورشة للمركبة كملف PDF - وصول عام"""
+    from utils.weasyprint_workshop_pdf import generate_workshop_report_pdf
     try:
         # جلب بيانات المركبة
         vehicle = Vehicle.query.get_or_404(id)
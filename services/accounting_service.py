@@ -1,12 +1,13 @@
 """
 خدمات النظام المحاسبي
 """
-from datetime import datetime, date, timedelta
+from datetime import date, timedelta
 from decimal import Decimal
 from sqlalchemy import func, and_, or_
 from app import db
 from models_accounting import *
 from models import Employee, Vehicle
+from services import journal_posting, ledger_balances
 
 
 class AccountingService:
@@ -195,20 +196,8 @@ class AccountingService:
             if not salary_account or not cash_account:
                 return False, "الحسابات المحاسبية للرواتب غير موجودة"
             
-            # الإعدادات
-            settings = AccountingSettings.query.first()
-            if not settings:
-                settings = AccountingSettings(
-                    company_name='شركة نُظم',
-                    next_transaction_number=1
-                )
-                db.session.add(settings)
-                db.session.flush()
-            
-            fiscal_year = FiscalYear.query.filter_by(is_active=True).first()
-            
-            total_processed = 0
             total_amount = Decimal('0')
+            entries = []
             
             for employee in employees:
                 if not employee.salary or employee.salary <= 0:
@@ -223,52 +212,21 @@ class AccountingService:
                 if net_salary <= 0:
                     continue
                 
-                # إنشاء معاملة الراتب
-                transaction_number = f"{settings.transaction_prefix}{settings.next_transaction_number:06d}"
-                
-                transaction = Transaction(
-                    transaction_number=transaction_number,
-                    transaction_date=date(year, month, 1),
-                    transaction_type=TransactionType.SALARY,
-                    description=f"راتب شهر {month}/{year} - {employee.name}",
-                    total_amount=net_salary,
-                    fiscal_year_id=fiscal_year.id,
-                    employee_id=employee.id,
-                    created_by_id=1,  # النظام
-                    is_approved=True,
-                    approval_date=datetime.utcnow()
-                )
-                
-                db.session.add(transaction)
-                db.session.flush()
-                
-                # القيود
-                debit_entry = TransactionEntry(
-                    transaction_id=transaction.id,
-                    account_id=salary_account.id,
-                    entry_type=EntryType.DEBIT,
-                    amount=net_salary,
-                    description=f"راتب {employee.name}"
-                )
-                
-                credit_entry = TransactionEntry(
-                    transaction_id=transaction.id,
-                    account_id=cash_account.id,
-                    entry_type=EntryType.CREDIT,
-                    amount=net_salary,
-                    description=f"صرف راتب {employee.name}"
-                )
-                
-                db.session.add(debit_entry)
-                db.session.add(credit_entry)
-                
-                # تحديث الأرصدة
-                salary_account.balance += net_salary
-                cash_account.balance -= net_salary
-                
-                total_processed += 1
+                entries.append({
+                    'transaction_date': date(year, month, 1),
+                    'transaction_type': TransactionType.SALARY,
+                    'description': f"راتب شهر {month}/{year} - {employee.name}",
+                    'employee_id': employee.id,
+                    'lines': [
+                        journal_posting.debit(salary_account.id, net_salary, f"راتب {employee.name}"),
+                        journal_posting.credit(cash_account.id, net_salary, f"صرف راتب {employee.name}")
+                    ]
+                })
                 total_amount += net_salary
-                settings.next_transaction_number += 1
+            
+            # ترحيل القيود دفعة واحدة
+            journal_posting.post(entries, 1)  # النظام
+            total_processed = len(entries)
             
             db.session.commit()
             return True, f"تم معالجة {total_processed} راتب بإجمالي {total_amount:,.2f} ريال"
@@ -288,26 +246,8 @@ class AccountingService:
             if not account:
                 return Decimal('0')
             
-            # جمع المدين والدائن
-            debits = db.session.query(func.sum(TransactionEntry.amount)).join(Transaction).filter(
-                TransactionEntry.account_id == account_id,
-                TransactionEntry.entry_type == EntryType.DEBIT,
-                Transaction.transaction_date <= as_of_date,
-                Transaction.is_approved == True
-            ).scalar() or Decimal('0')
-            
-            credits = db.session.query(func.sum(TransactionEntry.amount)).join(Transaction).filter(
-                TransactionEntry.account_id == account_id,
-                TransactionEntry.entry_type == EntryType.CREDIT,
-                Transaction.transaction_date <= as_of_date,
-                Transaction.is_approved == True
-            ).scalar() or Decimal('0')
-            
-            # حساب الرصيد حسب نوع الحساب
-            if account.account_type in [AccountType.ASSETS, AccountType.EXPENSES]:
-                balance = debits - credits
-            else:
-                balance = credits - debits
+            # من اللقطات الشهرية، والشهر الجزئي الأخير من القيود
+            balance = ledger_balances.account_balance(account, include_children=False, as_of=as_of_date)
             
             return balance
             
@@ -362,16 +302,9 @@ class AccountingService:
     
     @staticmethod
     def update_account_balances():
-        """تحديث أرصدة جميع الحسابات"""
+        """تحديث أرصدة جميع الحسابات (إعادة بناء اللقطات الشهرية والأرصدة من القيود المعتمدة)"""
         try:
-            accounts = Account.query.filter_by(is_active=True).all()
-            
-            for account in accounts:
-                balance = AccountingService.calculate_account_balance(account.id)
-                account.balance = balance
-                account.updated_at = datetime.utcnow()
-            
-            db.session.commit()
+            ledger_balances.rebuild()
             return True, "تم تحديث الأرصدة بنجاح"
             
         except Exception as e:
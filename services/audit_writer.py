@@ -0,0 +1,166 @@
+"""
+كاتب سجل المراجعة في الخلفية
+
+log_activity كانت تضيف السجل إلى db.session وتحفظ فوراً: حفظ إضافي لكل عملية، وقد
+تحفظ معه تغييرات معلقة للطلب لم يقصد صاحبها حفظها. الآن:
+
+- سجلات الطلب الواحد تُجمع في g ولا تلمس db.session
+- عند انتهاء الطلب (teardown) تُسلم دفعة واحدة لقائمة محدودة الحجم (AUDIT_QUEUE_SIZE)
+- خيط واحد في كل عملية يسحب الدفعات ويكتبها بأمر insert واحد لكل جدول في اتصال مستقل
+- إذا امتلأت القائمة تُكتب الدفعة مباشرة في نفس الطلب (لا يضيع أي سجل ولا تنمو الذاكرة)
+- خارج الطلبات (أوامر CLI والمهام الدورية) تُرسل السجلات للقائمة مباشرة، وتُفرغ القائمة
+  عند خروج العملية
+
+AUDIT_ASYNC=0 يكتب دفعة الطلب مباشرة عند انتهائه بدون الخيط (مفيد في الاختبارات).
+"""
+import atexit
+import logging
+import os
+import queue
+import threading
+
+from flask import current_app, g, has_app_context, has_request_context
+from sqlalchemy import insert
+from sqlalchemy.exc import SQLAlchemyError
+
+from app import db
+
+logger = logging.getLogger('audit')
+
+QUEUE_SIZE = int(os.environ.get('AUDIT_QUEUE_SIZE', 1000))
+BATCH_SIZE = int(os.environ.get('AUDIT_BATCH_SIZE', 500))
+ASYNC = os.environ.get('AUDIT_ASYNC', '1').lower() not in ('0', 'false', 'no')
+
+_queue = queue.Queue(maxsize=QUEUE_SIZE)
+_lock = threading.Lock()
+_worker = None
+_worker_pid = None
+_app = None
+
+
+def _tables():
+    from models import AuditLog, SystemAudit
+    return {'audit_log': AuditLog.__table__, 'system_audit': SystemAudit.__table__}
+
+
+def write(records):
+    """كتابة سجلات [(الجدول، القيم)] بأمر insert واحد لكل جدول؛ عند فشله سجلاً سجلاً"""
+    grouped = {}
+    for table_name, values in records:
+        grouped.setdefault(table_name, []).append(values)
+
+    tables = _tables()
+    for table_name, rows in grouped.items():
+        table = tables[table_name]
+        try:
+            with db.engine.begin() as conn:
+                conn.execute(insert(table), rows)
+            continue
+        except SQLAlchemyError as e:
+            logger.warning("audit batch insert failed table=%s rows=%d error=%s",
+                           table_name, len(rows), e.__class__.__name__)
+        for row in rows:
+            try:
+                with db.engine.begin() as conn:
+                    conn.execute(insert(table), [row])
+            except SQLAlchemyError as e:
+                logger.error("audit record dropped table=%s action=%s entity=%s error=%s",
+                             table_name, row.get('action'), row.get('entity_type'),
+                             getattr(e, 'orig', e))
+
+
+def _run():
+    while True:
+        records = _queue.get()
+        pending = 1
+        # دمج ما ينتظر في القائمة في دفعة واحدة
+        while len(records) < BATCH_SIZE:
+            try:
+                records = records + _queue.get_nowait()
+                pending += 1
+            except queue.Empty:
+                break
+        try:
+            with _app.app_context():
+                write(records)
+        except Exception:
+            logger.exception("audit writer failed records=%d", len(records))
+        finally:
+            for _ in range(pending):
+                _queue.task_done()
+
+
+def _ensure_worker():
+    global _worker, _worker_pid, _app
+    pid = os.getpid()
+    if _worker is not None and _worker_pid == pid and _worker.is_alive():
+        return
+    with _lock:
+        if _worker is not None and _worker_pid == pid and _worker.is_alive():
+            return
+        _app = current_app._get_current_object()
+        _worker = threading.Thread(target=_run, name='audit-writer', daemon=True)
+        _worker_pid = pid
+        _worker.start()
+
+
+def submit(records):
+    """تسليم دفعة للكاتب؛ تُكتب مباشرة إذا كان الكاتب معطلاً أو القائمة ممتلئة"""
+    if not records:
+        return
+    if not ASYNC:
+        write(records)
+        return
+    _ensure_worker()
+    try:
+        _queue.put_nowait(records)
+    except queue.Full:
+        logger.warning("audit queue full, writing inline records=%d", len(records))
+        write(records)
+
+
+def record(table_name, values):
+    """إضافة سجل: يُجمع مع سجلات الطلب الحالي، أو يُرسل مباشرة خارج الطلبات"""
+    logger.info("audit table=%s action=%s entity=%s id=%s user=%s", table_name, values.get('action'),
+                values.get('entity_type'), values.get('entity_id'), values.get('user_id'))
+    if has_request_context():
+        g.setdefault('_audit_records', []).append((table_name, values))
+    elif has_app_context():
+        submit([(table_name, values)])
+    else:
+        logger.error("audit record outside app context dropped action=%s", values.get('action'))
+
+
+def flush(timeout=None):
+    """انتظار كتابة كل ما في القائمة (للأوامر والاختبارات وعند الخروج)"""
+    if _worker is None or _worker_pid != os.getpid() or not _worker.is_alive():
+        return
+    if timeout is None:
+        _queue.join()
+        return
+    done = threading.Event()
+    threading.Thread(target=lambda: (_queue.join(), done.set()), daemon=True).start()
+    done.wait(timeout)
+
+
+def _flush_request(exc=None):
+    records = g.pop('_audit_records', None)
+    if records:
+        # جلسة الطلب تُنهى قبل الكتابة: معاملة مفتوحة (تعديلات لم تُحفظ أو قراءة) تحجز
+        # قاعدة SQLite فيفشل الكاتب بـ "database is locked"، والتعديلات غير المحفوظة
+        # كانت ستُلغى عند نهاية السياق على أي حال
+        try:
+            db.session.rollback()
+        except Exception:
+            logger.exception("audit flush could not end request session")
+        try:
+            submit(records)
+        except Exception:
+            logger.exception("audit flush failed records=%d", len(records))
+
+
+def init_app(app):
+    app.teardown_request(_flush_request)
+
+
+atexit.register(flush, 5)
@@ -0,0 +1,863 @@
+"""
+نسخ احتياطي واستعادة متدفقة لقاعدة البيانات
+
+تنسيق النسخة (الإصدار 3): ملف ZIP بدون ضغط إضافي يحتوي:
+- manifest.json: وقت الإنشاء والجداول، ولكل جدول أعمدته وعدد سجلاته واسم ملفه
+- <الجدول>.ndjson.gz: سجل واحد في كل سطر كمصفوفة JSON بترتيب أعمدة الـ manifest
+
+التصدير يقرأ كل جدول بمؤشر متدفق (stream_results/yield_per) ويكتب مباشرة إلى ملف
+مؤقت في instance/backups، فالذاكرة المستخدمة ثابتة مهما كان حجم القاعدة. في PostgreSQL
+تُقرأ كل الجداول في معاملة REPEATABLE READ واحدة فتكون النسخة متسقة.
+
+الاستعادة تقرأ كل ملف سطراً بسطر وتُدخل السجلات على دفعات (BACKUP_BATCH_SIZE) بأمر
+insert واحد لكل دفعة مع ON CONFLICT حسب الوضع:
+- add: تجاهل السجلات الموجودة
+- merge: تحديث السجلات الموجودة بقيم النسخة
+- replace: حذف بيانات الجداول المختارة أولاً (بعكس ترتيب المفاتيح الأجنبية)
+
+الجداول تُحمل على مستويات حسب المفاتيح الأجنبية، وجداول المستوى الواحد بالتوازي
+(BACKUP_RESTORE_WORKERS). المفاتيح الأجنبية الدائرية القابلة للفراغ (القسم ومديره مثلاً)
+تُدخل فارغة ثم تُحدّث بعد تحميل كل الجداول.
+
+ملفات JSON القديمة (الإصدار 2 وتصدير الجدول الواحد) ما زالت مقبولة وتمر بنفس المحمّل.
+
+النسخ التزايدية:
+- كل نسخة متتبعة (full أو incremental) تُسجل في backup_runs وتحفظ لكل جدول نقطة
+  (backup_watermarks) هي وقت بدء قراءتها
+- النسخة التزايدية تصدّر من كل جدول ما عُدّل بعد نقطته (updated_at) مع هامش
+  WATERMARK_OVERLAP لتغطية المعاملات التي حُفظت متأخرة؛ الجداول بدون updated_at
+  أو بدون نقطة سابقة تُنسخ كاملة
+- الحذف يُلتقط بأحداث SQLAlchemy (حذف الكائنات و query.delete) في جدول
+  backup_tombstones داخل نفس المعاملة، ويُصدَّر مع النسخة التزايدية
+- الاستعادة تطبق نسخة كاملة ثم سلسلة النسخ التزايدية بالترتيب (restore_chain)،
+  وكل نسخة تزايدية تحذف ما في سجل الحذف ثم تدمج السجلات المعدلة
+
+الإدخال المباشر لا يمر بأحداث الجلسة التي تحدّث فهرس البحث (services/search_index)،
+فبعد الاستعادة يُعاد بناء فهرس الجداول المستعادة (SEARCH_ENTITIES).
+"""
+import base64
+import enum
+import gzip
+import io
+import json
+import logging
+import os
+import time as clock
+import uuid
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+
+from flask import current_app
+from sqlalchemy import and_, bindparam, delete, event, func, insert, inspect, or_, select, text, update
+from sqlalchemy import Enum as SAEnum
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+
+from app import db
+from services import search_index
+from models import (
+    Employee, Vehicle, Department, User, Salary, Attendance,
+    MobileDevice, VehicleHandover, VehicleWorkshop, Document,
+    VehicleAccident, EmployeeRequest, RentalProperty, PropertyPayment,
+    PropertyImage, PropertyFurnishing, Geofence, GeofenceSession,
+    SimCard, VoiceHubCall, VehicleExternalSafetyCheck, VehicleSafetyImage,
+    BackupRun, BackupWatermark, BackupTombstone
+)
+
+logger = logging.getLogger(__name__)
+
+FORMAT_VERSION = '3.0'
+MANIFEST_NAME = 'manifest.json'
+TOMBSTONES_NAME = '_tombstones.ndjson.gz'
+
+BATCH_SIZE = int(os.environ.get('BACKUP_BATCH_SIZE', 1000))
+RESTORE_WORKERS = int(os.environ.get('BACKUP_RESTORE_WORKERS', 4))
+
+MODES = ('add', 'merge', 'replace')
+KINDS = ('full', 'incremental')
+
+WATERMARK_OVERLAP = timedelta(seconds=int(os.environ.get('BACKUP_WATERMARK_OVERLAP_SECONDS', 300)))
+# سجلات الحذف لجداول لم تُنسخ نسخة متتبعة بعد تُحذف بعد هذه المدة
+TOMBSTONE_RETENTION = timedelta(days=int(os.environ.get('BACKUP_TOMBSTONE_RETENTION_DAYS', 90)))
+
+BACKUP_TABLES = {
+    'employees': Employee,
+    'vehicles': Vehicle,
+    'departments': Department,
+    'users': User,
+    'salaries': Salary,
+    'attendance': Attendance,
+    'mobile_devices': MobileDevice,
+    'vehicle_handovers': VehicleHandover,
+    'vehicle_workshops': VehicleWorkshop,
+    'documents': Document,
+    'vehicle_accidents': VehicleAccident,
+    'employee_requests': EmployeeRequest,
+    'rental_properties': RentalProperty,
+    'property_payments': PropertyPayment,
+    'property_images': PropertyImage,
+    'property_furnishings': PropertyFurnishing,
+    'geofences': Geofence,
+    'geofence_sessions': GeofenceSession,
+    'sim_cards': SimCard,
+    'voicehub_calls': VoiceHubCall,
+    'external_safety_checks': VehicleExternalSafetyCheck,
+    'safety_images': VehicleSafetyImage,
+}
+
+# جداول النسخة -> أنواع فهرس البحث التي تُبنى منها (اسم الموظف جزء من فهرس وثائقه)
+SEARCH_ENTITIES = {
+    'employees': ('employee', 'document'),
+    'vehicles': ('vehicle',),
+    'documents': ('document',),
+}
+
+
+class BackupFormatError(ValueError):
+    """ملف النسخة الاحتياطية غير صالح أو بتنسيق غير مدعوم"""
+
+
+def backup_dir():
+    path = os.path.join(current_app.instance_path, 'backups')
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def temp_path(suffix):
+    return os.path.join(backup_dir(), f'{uuid.uuid4().hex}{suffix}')
+
+
+def _table(name):
+    return BACKUP_TABLES[name].__table__
+
+
+# ---------------------------------------------------------------------------
+# تحويل القيم
+# ---------------------------------------------------------------------------
+
+def _dump_value(value):
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, (datetime, date, time)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, enum.Enum):
+        return value.name
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return base64.b64encode(bytes(value)).decode('ascii')
+    if isinstance(value, (dict, list)):
+        return value
+    return str(value)
+
+
+def _parse_datetime(value):
+    if isinstance(value, datetime):
+        return value
+    value = value.replace('Z', '+00:00')
+    if 'T' not in value and ' ' not in value:
+        return datetime.strptime(value, '%Y-%m-%d')
+    return datetime.fromisoformat(value)
+
+
+def _parse_date(value):
+    if 'T' in value or ' ' in value:
+        return _parse_datetime(value).date()
+    return date.fromisoformat(value)
+
+
+def _enum_converter(enum_class):
+    def convert(value):
+        # النسخ القديمة حفظت الـ Enum كنص "UserRole.ADMIN" أو بقيمته "admin"
+        name = value.split('.', 1)[1] if value.startswith(f'{enum_class.__name__}.') else value
+        if name in enum_class.__members__:
+            return enum_class[name]
+        return enum_class(value)
+    return convert
+
+
+def _converter(column):
+    """دالة تحويل قيمة JSON إلى نوع العمود، أو None إذا كانت القيمة صالحة كما هي"""
+    col_type = column.type
+    if isinstance(col_type, SAEnum) and col_type.enum_class is not None:
+        return _enum_converter(col_type.enum_class)
+    try:
+        python_type = col_type.python_type
+    except NotImplementedError:
+        return None
+    if python_type is datetime:
+        return _parse_datetime
+    if python_type is date:
+        return _parse_date
+    if python_type is time:
+        return time.fromisoformat
+    if python_type is Decimal:
+        return lambda value: Decimal(str(value))
+    if python_type is bytes:
+        return base64.b64decode
+    return None
+
+
+def _converters(table, columns):
+    result = {}
+    for name in columns:
+        if name in table.c:
+            convert = _converter(table.c[name])
+            if convert is not None:
+                result[name] = convert
+    return result
+
+
+def _convert_row(values, converters):
+    for name, convert in converters.items():
+        value = values.get(name)
+        if value is None or value == '':
+            values[name] = None
+            continue
+        try:
+            values[name] = convert(value)
+        except (TypeError, ValueError, KeyError):
+            values[name] = None
+    return values
+
+
+# ---------------------------------------------------------------------------
+# إحصائيات الجداول
+# ---------------------------------------------------------------------------
+
+def estimated_counts(table_names=None):
+    """
+    عدد السجلات التقريبي لكل جدول
+
+    في PostgreSQL من إحصائيات الفهرس (pg_class.reltuples) بدون مسح الجداول، ويُعد
+    فعلياً فقط الجدول الذي لم يُحلل بعد. في غيره count(*) عادي.
+    """
+    names = list(table_names or BACKUP_TABLES)
+    counts = {}
+    with db.engine.connect() as conn:
+        if conn.dialect.name == 'postgresql':
+            physical = {_table(name).name: name for name in names}
+            rows = conn.execute(text(
+                "SELECT c.relname, c.reltuples::bigint AS estimate FROM pg_class c "
+                "JOIN pg_namespace n ON n.oid = c.relnamespace "
+                "WHERE c.relkind IN ('r', 'p') AND n.nspname = current_schema() "
+                "AND c.relname = ANY(:names)"
+            ), {'names': list(physical)})
+            for row in rows:
+                if row.estimate is not None and row.estimate >= 0:
+                    counts[physical[row.relname]] = int(row.estimate)
+        for name in names:
+            if name in counts:
+                continue
+            try:
+                counts[name] = conn.execute(select(func.count()).select_from(_table(name))).scalar() or 0
+            except SQLAlchemyError:
+                conn.rollback()
+                counts[name] = 0
+    return counts
+
+
+# ---------------------------------------------------------------------------
+# سجل الحذف
+# ---------------------------------------------------------------------------
+
+_tracked_tables = None
+
+
+def _tracked():
+    """{جدول SQLAlchemy: اسمه في النسخة الاحتياطية}"""
+    global _tracked_tables
+    if _tracked_tables is None:
+        _tracked_tables = {model.__table__: name for name, model in BACKUP_TABLES.items()}
+    return _tracked_tables
+
+
+def _record_tombstones(connection, name, table, keys):
+    if not keys:
+        return
+    columns = [column.name for column in table.primary_key.columns]
+    now = datetime.utcnow()
+    connection.execute(insert(BackupTombstone.__table__), [
+        {'table_name': name, 'deleted_at': now,
+         'row_key': json.dumps(dict(zip(columns, [_dump_value(v) for v in key])), ensure_ascii=False)}
+        for key in keys
+    ])
+
+
+@event.listens_for(Session, 'after_flush')
+def _capture_deleted_objects(session, flush_context):
+    """حذف كائنات ORM (session.delete) يُسجل في نفس المعاملة، فيُلغى معها عند التراجع"""
+    deleted = {}
+    for obj in session.deleted:
+        table = getattr(obj, '__table__', None)
+        name = _tracked().get(table)
+        if name is not None:
+            deleted.setdefault((name, table), []).append(inspect(obj).identity)
+    for (name, table), keys in deleted.items():
+        _record_tombstones(session.connection(), name, table, [k for k in keys if k])
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def _capture_bulk_deletes(orm_execute_state):
+    """query.delete() و delete(Model) لا تمر بـ after_flush: نقرأ مفاتيح السجلات قبل حذفها"""
+    if not orm_execute_state.is_delete or orm_execute_state.bind_mapper is None:
+        return
+    table = orm_execute_state.bind_mapper.local_table
+    name = _tracked().get(table)
+    if name is None:
+        return
+    query = select(*table.primary_key.columns)
+    where = orm_execute_state.statement.whereclause
+    if where is not None:
+        query = query.where(where)
+    session = orm_execute_state.session
+    keys = [tuple(row) for row in session.connection().execute(query, orm_execute_state.parameters or {})]
+    _record_tombstones(session.connection(), name, table, keys)
+
+
+def prune_tombstones():
+    """حذف سجلات الحذف التي غطتها نسخة متتبعة لكل جداولها (أو الأقدم من TOMBSTONE_RETENTION)"""
+    tombstones = BackupTombstone.__table__
+    marks = {row.table_name: row.high_water for row in BackupWatermark.query.all()}
+    conditions = [and_(tombstones.c.table_name == name, tombstones.c.deleted_at < mark - WATERMARK_OVERLAP)
+                  for name, mark in marks.items()]
+    conditions.append(tombstones.c.deleted_at < datetime.utcnow() - TOMBSTONE_RETENTION)
+    with db.engine.begin() as conn:
+        return conn.execute(delete(tombstones).where(or_(*conditions))).rowcount
+
+
+# ---------------------------------------------------------------------------
+# التصدير
+# ---------------------------------------------------------------------------
+
+def _write_lines(archive, member, batches):
+    count = 0
+    with archive.open(member, 'w', force_zip64=True) as raw:
+        with gzip.GzipFile(fileobj=raw, mode='wb', compresslevel=6) as gz:
+            for rows in batches:
+                lines = [json.dumps(row, ensure_ascii=False, separators=(',', ':')) for row in rows]
+                if lines:
+                    gz.write(('\n'.join(lines) + '\n').encode('utf-8'))
+                    count += len(lines)
+    return count
+
+
+def _write_table(conn, archive, name, batch_size, since=None):
+    """
+    كتابة جدول كاملاً، أو ما عُدّل منه بعد since فقط إذا كان فيه عمود updated_at
+
+    :return: معلومات الجدول في الـ manifest
+    """
+    table = _table(name)
+    columns = [column.name for column in table.columns]
+    query = select(table)
+    if since is not None and 'updated_at' in table.c:
+        query = query.where(table.c.updated_at >= since - WATERMARK_OVERLAP)
+    else:
+        since = None
+
+    result = conn.execution_options(stream_results=True, yield_per=batch_size).execute(query)
+    member = f'{name}.ndjson.gz'
+    batches = ([[_dump_value(value) for value in row] for row in rows] for rows in result.partitions())
+    count = _write_lines(archive, member, batches)
+    return {'file': member, 'columns': columns, 'count': count,
+            'since': since.isoformat() if since else None}
+
+
+def _write_tombstones(conn, archive, marks, batch_size):
+    """سجلات الحذف منذ نقطة كل جدول: [الجدول، {المفتاح}] في كل سطر"""
+    tombstones = BackupTombstone.__table__
+    if not marks:
+        return 0
+    conditions = [and_(tombstones.c.table_name == name, tombstones.c.deleted_at >= mark - WATERMARK_OVERLAP)
+                  for name, mark in marks.items()]
+    query = select(tombstones.c.table_name, tombstones.c.row_key).where(or_(*conditions)) \
+        .order_by(tombstones.c.id)
+    result = conn.execution_options(stream_results=True, yield_per=batch_size).execute(query)
+    batches = ([[row.table_name, json.loads(row.row_key)] for row in rows] for rows in result.partitions())
+    return _write_lines(archive, TOMBSTONES_NAME, batches)
+
+
+def _record_run(manifest, names, snapshot_at, size_bytes, duration_ms):
+    """حفظ النسخة في السجل وتقديم نقطة كل جدول نُسخ إلى وقت بدء القراءة"""
+    run = BackupRun(
+        id=manifest['backup_id'],
+        kind=manifest['kind'],
+        parent_id=manifest['parent_id'],
+        created_by=manifest['created_by'],
+        snapshot_at=snapshot_at,
+        table_count=len(names),
+        row_count=sum(info['count'] for info in manifest['tables'].values()),
+        tombstone_count=manifest['tombstones']['count'],
+        size_bytes=size_bytes,
+        duration_ms=duration_ms,
+    )
+    db.session.add(run)
+    db.session.flush()
+    for name in names:
+        mark = db.session.get(BackupWatermark, name) or BackupWatermark(table_name=name)
+        mark.high_water = snapshot_at
+        mark.backup_id = run.id
+        mark.updated_at = datetime.utcnow()
+        db.session.add(mark)
+    db.session.commit()
+    return run
+
+
+def last_run():
+    return BackupRun.query.order_by(BackupRun.created_at.desc()).first()
+
+
+def export_archive(table_names=None, created_by=None, batch_size=None, dest=None, kind=None):
+    """
+    كتابة نسخة احتياطية للجداول المختارة
+
+    :param kind: None لنسخة غير متتبعة (تصدير جدول واحد مثلاً)، 'full' لنسخة كاملة
+                 تبدأ سلسلة جديدة، 'incremental' لما تغيّر منذ آخر نسخة متتبعة
+    :return: (مسار الملف، الـ manifest)
+    """
+    if kind is not None and kind not in KINDS:
+        raise ValueError(f'نوع نسخة غير معروف: {kind}')
+    names = [name for name in (table_names or BACKUP_TABLES) if name in BACKUP_TABLES]
+    batch_size = batch_size or BATCH_SIZE
+    dest = dest or temp_path('.zip')
+    started = clock.monotonic()
+
+    marks, parent = {}, None
+    if kind == 'incremental':
+        parent = last_run()
+        marks = {row.table_name: row.high_water
+                 for row in BackupWatermark.query.filter(BackupWatermark.table_name.in_(names))}
+        if parent is None:
+            kind = 'full'  # لا توجد نسخة سابقة نبني عليها
+
+    manifest = {
+        'version': FORMAT_VERSION,
+        'format': 'ndjson.gz',
+        'kind': kind or 'full',
+        'backup_id': uuid.uuid4().hex,
+        'parent_id': parent.id if parent and kind == 'incremental' else None,
+        'created_at': datetime.now().isoformat(),
+        'created_by': created_by or 'System',
+        'tables': {},
+        'tombstones': {'file': TOMBSTONES_NAME, 'count': 0},
+    }
+
+    try:
+        with zipfile.ZipFile(dest, 'w', compression=zipfile.ZIP_STORED, allowZip64=True) as archive:
+            with db.engine.connect() as conn:
+                if conn.dialect.name == 'postgresql':
+                    conn = conn.execution_options(isolation_level='REPEATABLE READ')
+                with conn.begin():
+                    # وقت البدء يُؤخذ قبل أول قراءة: كل ما يُحفظ بعدها يدخل في النسخة التالية
+                    snapshot_at = datetime.utcnow()
+                    manifest['snapshot_at'] = snapshot_at.isoformat()
+                    for name in names:
+                        manifest['tables'][name] = _write_table(conn, archive, name, batch_size,
+                                                                since=marks.get(name))
+                    if manifest['kind'] == 'incremental':
+                        manifest['tombstones']['count'] = _write_tombstones(conn, archive, marks, batch_size)
+            archive.writestr(MANIFEST_NAME, json.dumps(manifest, ensure_ascii=False, indent=2))
+    except Exception:
+        if os.path.exists(dest):
+            os.remove(dest)
+        raise
+
+    if kind is not None:
+        _record_run(manifest, names, snapshot_at, os.path.getsize(dest),
+                    int((clock.monotonic() - started) * 1000))
+        try:
+            prune_tombstones()
+        except SQLAlchemyError as e:
+            logger.warning(f"تعذر تنظيف سجل الحذف: {e}")
+
+    logger.info(f"نسخة احتياطية ({manifest['kind']}): {len(names)} جدول، "
+                f"{sum(t['count'] for t in manifest['tables'].values())} سجل، "
+                f"{manifest['tombstones']['count']} حذف -> {dest}")
+    return dest, manifest
+
+
+# ---------------------------------------------------------------------------
+# ترتيب الجداول حسب المفاتيح الأجنبية
+# ---------------------------------------------------------------------------
+
+def load_plan(names):
+    """
+    تقسيم الجداول إلى مستويات تُحمل بالترتيب (جداول المستوى الواحد مستقلة عن بعضها)
+
+    :return: (المستويات، {الجدول: [أعمدة مؤجلة]})؛ الأعمدة المؤجلة مفاتيح أجنبية
+             دائرية قابلة للفراغ تُدخل فارغة ثم تُحدّث في النهاية
+    """
+    by_table = {_table(name): name for name in names}
+    deps = {name: {} for name in names}
+    for table, name in by_table.items():
+        for fk in table.foreign_keys:
+            target = by_table.get(fk.column.table)
+            if target and target != name:
+                deps[name].setdefault(target, []).append(fk.parent)
+
+    levels, deferred, remaining, done = [], {}, set(names), set()
+    while remaining:
+        ready = sorted(name for name in remaining if set(deps[name]) <= done)
+        if not ready:
+            # دورة: نؤجل أعمدة الدورة القابلة للفراغ في الجدول الأقل اعتماداً
+            name = min(sorted(remaining), key=lambda n: len(set(deps[n]) - done))
+            for target in set(deps[name]) - done:
+                columns = deps[name][target]
+                if all(column.nullable for column in columns):
+                    deferred.setdefault(name, []).extend(column.name for column in columns)
+                del deps[name][target]
+            continue
+        levels.append(ready)
+        done.update(ready)
+        remaining.difference_update(ready)
+    return levels, deferred
+
+
+# ---------------------------------------------------------------------------
+# مصادر السجلات
+# ---------------------------------------------------------------------------
+
+class ArchiveSource:
+    """قراءة نسخة بالتنسيق الجديد؛ كل استدعاء لـ rows يفتح الملف من جديد (آمن للخيوط)"""
+
+    def __init__(self, path):
+        self.path = path
+        try:
+            with zipfile.ZipFile(path) as archive:
+                self.manifest = json.loads(archive.read(MANIFEST_NAME))
+        except (zipfile.BadZipFile, KeyError, ValueError) as e:
+            raise BackupFormatError(f'ملف النسخة الاحتياطية غير صالح: {e}')
+        self.tables = {name: info for name, info in self.manifest.get('tables', {}).items()
+                       if name in BACKUP_TABLES}
+
+    kind = property(lambda self: self.manifest.get('kind', 'full'))
+    backup_id = property(lambda self: self.manifest.get('backup_id'))
+    parent_id = property(lambda self: self.manifest.get('parent_id'))
+    created_at = property(lambda self: self.manifest.get('created_at') or '')
+
+    def tombstones(self):
+        """(الجدول، {المفتاح}) لكل سجل محذوف في النسخة التزايدية"""
+        info = self.manifest.get('tombstones') or {}
+        if not info.get('count'):
+            return
+        with zipfile.ZipFile(self.path) as archive:
+            with archive.open(info['file']) as raw, gzip.GzipFile(fileobj=raw) as gz:
+                for line in io.TextIOWrapper(gz, encoding='utf-8'):
+                    if line.strip():
+                        name, key = json.loads(line)
+                        yield name, key
+
+    def rows(self, name):
+        info = self.tables[name]
+        columns = info['columns']
+        with zipfile.ZipFile(self.path) as archive:
+            with archive.open(info['file']) as raw, gzip.GzipFile(fileobj=raw) as gz:
+                for line in io.TextIOWrapper(gz, encoding='utf-8'):
+                    if line.strip():
+                        yield dict(zip(columns, json.loads(line)))
+
+
+class LegacyJsonSource:
+    """ملفات JSON من الإصدار 2 أو تصدير الجدول الواحد القديم (تُقرأ كاملة)"""
+
+    def __init__(self, path):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (ValueError, UnicodeDecodeError):
+            raise BackupFormatError('ملف JSON غير صالح')
+        if not isinstance(data, dict):
+            raise BackupFormatError('ملف النسخة الاحتياطية غير صالح')
+
+        if 'data' not in data:
+            tables = {k: v for k, v in data.items() if isinstance(v, list)}
+        elif isinstance(data.get('metadata'), dict) and 'table_name' in data['metadata']:
+            tables = {data['metadata']['table_name']: data.get('data', [])}
+        else:
+            tables = data['data']
+        if not isinstance(tables, dict) or not tables:
+            raise BackupFormatError('تنسيق ملف النسخة الاحتياطية غير مدعوم')
+
+        self.manifest = data.get('metadata', {})
+        self._data = {name: records for name, records in tables.items()
+                      if name in BACKUP_TABLES and isinstance(records, list)}
+        self.tables = {name: {'count': len(records)} for name, records in self._data.items()}
+
+    kind = 'full'
+    backup_id = parent_id = None
+    created_at = property(lambda self: str(self.manifest.get('created_at') or ''))
+
+    def tombstones(self):
+        return iter(())
+
+    def rows(self, name):
+        for record in self._data[name]:
+            if isinstance(record, dict):
+                yield dict(record)
+
+
+def open_source(path):
+    """فتح ملف نسخة احتياطية بأي من التنسيقين"""
+    if zipfile.is_zipfile(path):
+        return ArchiveSource(path)
+    return LegacyJsonSource(path)
+
+
+# ---------------------------------------------------------------------------
+# الاستعادة
+# ---------------------------------------------------------------------------
+
+def _insert_statement(dialect, table, mode):
+    if dialect not in ('postgresql', 'sqlite') or mode == 'replace':
+        return insert(table)
+    stmt = (postgresql if dialect == 'postgresql' else sqlite).insert(table)
+    keys = [column.name for column in table.primary_key.columns]
+    if mode == 'merge':
+        updates = {column.name: stmt.excluded[column.name]
+                   for column in table.columns if column.name not in keys}
+        if updates:
+            return stmt.on_conflict_do_update(index_elements=keys, set_=updates)
+    return stmt.on_conflict_do_nothing(index_elements=keys)
+
+
+def _flush(stmt, batch, name, errors):
+    """إدخال دفعة بأمر واحد؛ عند فشلها تُعاد سجلاً سجلاً لتحديد السجل المعطوب"""
+    try:
+        with db.engine.begin() as conn:
+            conn.execute(stmt, batch)
+        return len(batch)
+    except SQLAlchemyError as e:
+        logger.warning(f"فشل إدخال دفعة في {name}، إعادة المحاولة سجلاً سجلاً: {e.__class__.__name__}")
+
+    count = 0
+    for values in batch:
+        try:
+            with db.engine.begin() as conn:
+                conn.execute(stmt, [values])
+            count += 1
+        except SQLAlchemyError as e:
+            if len(errors) < 50:
+                errors.append(f"{name}: {str(getattr(e, 'orig', e))[:200]}")
+    return count
+
+
+def _load_table(app, source, name, mode, batch_size, deferred):
+    with app.app_context():
+        table = _table(name)
+        valid = {column.name for column in table.columns}
+        stmt = _insert_statement(db.engine.dialect.name, table, mode)
+        converters = None
+        batch, count, errors = [], 0, []
+
+        for record in source.rows(name):
+            values = {k: v for k, v in record.items() if k in valid}
+            if converters is None:
+                converters = _converters(table, values.keys())
+            for column in deferred:
+                values[column] = None
+            batch.append(_convert_row(values, converters))
+            if len(batch) >= batch_size:
+                count += _flush(stmt, batch, name, errors)
+                batch = []
+        if batch:
+            count += _flush(stmt, batch, name, errors)
+        return name, count, errors
+
+
+def _restore_deferred(app, source, name, columns, batch_size):
+    """تعبئة المفاتيح الأجنبية الدائرية بعد تحميل كل الجداول"""
+    with app.app_context():
+        table = _table(name)
+        keys = [column.name for column in table.primary_key.columns]
+        stmt = update(table).where(*[table.c[k] == bindparam(f'_key_{k}') for k in keys]).values(
+            {column: bindparam(f'_val_{column}') for column in columns})
+        converters = _converters(table, keys + columns)
+        batch = []
+
+        def flush():
+            with db.engine.begin() as conn:
+                conn.execute(stmt, batch)
+
+        for record in source.rows(name):
+            if all(record.get(column) is None for column in columns):
+                continue
+            values = _convert_row({k: record.get(k) for k in keys + columns}, converters)
+            params = {f'_key_{k}': values[k] for k in keys}
+            params.update({f'_val_{c}': values[c] for c in columns})
+            batch.append(params)
+            if len(batch) >= batch_size:
+                flush()
+                batch = []
+        if batch:
+            flush()
+
+
+def _reset_sequences(names):
+    """مزامنة تسلسلات PostgreSQL مع أكبر معرف بعد إدخال المعرفات صراحة"""
+    with db.engine.begin() as conn:
+        if conn.dialect.name != 'postgresql':
+            return
+        for name in names:
+            table = _table(name)
+            for column in table.primary_key.columns:
+                if not column.autoincrement or not isinstance(column.type, db.Integer):
+                    continue
+                conn.execute(text(
+                    f'SELECT setval(pg_get_serial_sequence(:table, :column), '
+                    f'COALESCE((SELECT MAX("{column.name}") FROM "{table.name}"), 0) + 1, false) '
+                    f'WHERE pg_get_serial_sequence(:table, :column) IS NOT NULL'
+                ), {'table': table.name, 'column': column.name})
+
+
+def _apply_tombstones(source, table_names, batch_size):
+    """
+    حذف السجلات المحذوفة في النسخة التزايدية، الجداول الفرعية أولاً
+
+    المفاتيح تُجمع في الذاكرة لترتيب الحذف حسب المفاتيح الأجنبية (الحذف قليل مقارنة بالسجلات).
+    """
+    keys = {}
+    for name, key in source.tombstones():
+        if name in BACKUP_TABLES and (table_names is None or name in table_names):
+            keys.setdefault(name, []).append(key)
+    if not keys:
+        return 0
+
+    deleted = 0
+    levels, _ = load_plan(list(keys))
+    for level in reversed(levels):
+        for name in level:
+            table = _table(name)
+            columns = [column.name for column in table.primary_key.columns]
+            converters = _converters(table, columns)
+            rows = [_convert_row({c: key.get(c) for c in columns}, converters) for key in keys[name]]
+            for i in range(0, len(rows), batch_size):
+                batch = rows[i:i + batch_size]
+                if len(columns) == 1:
+                    condition = table.c[columns[0]].in_([row[columns[0]] for row in batch])
+                else:
+                    condition = or_(*[and_(*[table.c[c] == row[c] for c in columns]) for row in batch])
+                with db.engine.begin() as conn:
+                    deleted += conn.execute(delete(table).where(condition)).rowcount or 0
+    return deleted
+
+
+def _reindex(names):
+    """
+    إعادة بناء فهرس البحث للجداول المستعادة
+
+    :return: رسالة الخطأ أو None
+    """
+    entities = sorted({entity for name in names for entity in SEARCH_ENTITIES.get(name, ())})
+    if not entities:
+        return None
+    try:
+        search_index.rebuild(entities)
+    except SQLAlchemyError as e:
+        logger.error(f"تعذر إعادة بناء فهرس البحث بعد الاستعادة: {e}")
+        return f"فهرس البحث: {e} (أعد بناءه بـ flask search-index --rebuild)"
+    return None
+
+
+def restore(source, mode='add', table_names=None, batch_size=None, workers=None, reindex=True):
+    """
+    استعادة نسخة احتياطية
+
+    :param source: ArchiveSource أو LegacyJsonSource (أو مسار ملف)
+    :param reindex: إعادة بناء فهرس البحث للجداول المستعادة بعد التحميل
+    :return: (عدد السجلات لكل جدول، قائمة الأخطاء)
+    """
+    if mode not in MODES:
+        raise ValueError(f'وضع استيراد غير معروف: {mode}')
+    if isinstance(source, str):
+        source = open_source(source)
+
+    names = [name for name in source.tables if table_names is None or name in table_names]
+    batch_size = batch_size or BATCH_SIZE
+    if source.kind == 'incremental':
+        # النسخة التزايدية تُطبق فوق ما قبلها: حذف ثم دمج، ولا يُمسح أي جدول
+        mode = 'merge'
+        _apply_tombstones(source, table_names, batch_size)
+    if workers is None:
+        workers = RESTORE_WORKERS
+    if db.engine.dialect.name == 'sqlite':
+        workers = 1  # SQLite يسمح بكاتب واحد فقط
+    app = current_app._get_current_object()
+    levels, deferred = load_plan(names)
+
+    if mode == 'replace':
+        with db.engine.begin() as conn:
+            for level in reversed(levels):
+                for name in level:
+                    conn.execute(delete(_table(name)))
+
+    counts, errors = {}, []
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix='backup-restore') as pool:
+        for level in levels:
+            futures = [pool.submit(_load_table, app, source, name, mode, batch_size, deferred.get(name, []))
+                       for name in level]
+            for future in futures:
+                try:
+                    name, count, table_errors = future.result()
+                    counts[name] = count
+                    errors.extend(table_errors)
+                except Exception as e:
+                    logger.error(f"خطأ في استيراد جدول: {e}")
+                    errors.append(str(e))
+
+    for name, columns in deferred.items():
+        try:
+            _restore_deferred(app, source, name, columns, batch_size)
+        except Exception as e:
+            logger.error(f"خطأ في تعبئة المفاتيح المؤجلة لـ {name}: {e}")
+            errors.append(f"{name}: {e}")
+
+    try:
+        _reset_sequences(names)
+    except SQLAlchemyError as e:
+        logger.warning(f"تعذر مزامنة التسلسلات: {e}")
+
+    if reindex:
+        error = _reindex(names)
+        if error:
+            errors.append(error)
+
+    logger.info(f"استعادة نسخة احتياطية ({mode}): {sum(counts.values())} سجل في {len(counts)} جدول")
+    return counts, errors
+
+
+def restore_chain(paths, mode='replace', table_names=None, batch_size=None, workers=None):
+    """
+    استعادة نسخة كاملة ثم النسخ التزايدية المبنية عليها بترتيبها
+
+    الملفات تُرتب بوقت إنشائها، ويجب أن تبدأ بنسخة كاملة وأن تشير كل نسخة تزايدية
+    إلى التي قبلها مباشرة (parent_id)، وإلا تُرفض السلسلة قبل تعديل أي بيانات.
+
+    :param mode: طريقة استعادة النسخة الكاملة (النسخ التزايدية تُدمج دائماً)
+    :return: (عدد السجلات لكل جدول، قائمة الأخطاء)
+    """
+    sources = sorted((open_source(path) if isinstance(path, str) else path for path in paths),
+                     key=lambda source: source.created_at)
+    if not sources:
+        return {}, []
+    if sources[0].kind != 'full':
+        raise BackupFormatError('السلسلة يجب أن تبدأ بنسخة كاملة')
+    for previous, current in zip(sources, sources[1:]):
+        if current.kind != 'incremental' or current.parent_id != previous.backup_id:
+            raise BackupFormatError('سلسلة النسخ غير متصلة: نسخة تزايدية مفقودة أو من سلسلة أخرى')
+
+    totals, errors = {}, []
+    for source in sources:
+        # الفهرس يُبنى مرة واحدة بعد آخر نسخة في السلسلة
+        counts, source_errors = restore(source, mode=mode, table_names=table_names,
+                                        batch_size=batch_size, workers=workers, reindex=False)
+        for name, count in counts.items():
+            totals[name] = totals.get(name, 0) + count
+        errors.extend(source_errors)
+    error = _reindex(totals)
+    if error:
+        errors.append(error)
+    return totals, errors
@@ -0,0 +1,396 @@
+"""
+مخزن الملفات المعتمد على المحتوى (Content-Addressed Store)
+
+كل ملف يُحفظ مرة واحدة باسم بصمته SHA-256 في مجلدات مقسمة حسب أول البصمة:
+    static/uploads/blobs/3f/a2/3fa2...e9.jpg
+رفع نفس الصورة أو الملف مرة أخرى يعيد نفس المسار ويزيد عداد المراجع فقط.
+البصمة تُحسب أثناء كتابة الملف (قراءة واحدة على دفعات) دون تحميله كاملاً في الذاكرة.
+
+تماشياً مع سياسة حماية الملفات (services/file_retention.py) لا يُحذف أي ملف تلقائياً؛
+الملفات التي لا يشير إليها أي سجل تُحذف فقط عبر أمر الإدارة:
+    flask blobs-gc --confirm
+مسارات الحذف الكثيرة (الصور والوثائق وسجلات التسليم والورشة) لا تستدعي release() كلها،
+فالأمر لا يثق بعداد المراجع: يعدّ المراجع الفعلية من أعمدة النص في الجداول (count_references)
+ويصحح العداد، ولا يحذف ملفاً أحدث من GC_GRACE قد يكون مرجعه في معاملة لم تُحفظ بعد.
+"""
+import hashlib
+import io
+import logging
+import os
+import re
+import shutil
+import uuid
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+
+from sqlalchemy import JSON, Enum, String, Text, cast, inspect, select
+from sqlalchemy.exc import IntegrityError
+from werkzeug.utils import secure_filename
+
+from app import db
+from models import FileBlob
+
+logger = logging.getLogger(__name__)
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+UPLOADS_ROOT = os.path.join(PROJECT_ROOT, 'static', 'uploads')
+BLOB_ROOT = os.path.join(UPLOADS_ROOT, 'blobs')
+BLOB_PREFIX = 'static/uploads/blobs/'
+
+CHUNK_SIZE = 1024 * 1024
+
+# لا يُحذف ملف أُضيف أو أُشير إليه خلال هذه المدة (مرجعه قد يكون في معاملة لم تُحفظ)
+GC_GRACE = timedelta(hours=24)
+
+# جداول السجلات التاريخية: ذكر المسار فيها (مثل بيانات سجل محذوف) ليس مرجعاً حياً
+REFERENCE_EXCLUDED_TABLES = frozenset({
+    'file_blobs', 'audit_log', 'audit_logs', 'e_invoice_audit', 'scheduler_job_runs', 'search_index',
+})
+
+# مسار ملف في المخزن داخل أي نص (عمود مسار، قائمة مفصولة بفواصل، JSON)
+_REFERENCE = re.compile(r'blobs/[0-9a-f]{2}/[0-9a-f]{2}/([0-9a-f]{64})\.([A-Za-z0-9]+)')
+
+
+def _extension_of(filename, default='bin'):
+    """امتداد آمن بأحرف صغيرة من اسم الملف"""
+    if not filename or '.' not in filename:
+        return default
+    ext = secure_filename(filename.rsplit('.', 1)[1]).lower()
+    return ext[:16] or default
+
+
+def _iter_chunks(source):
+    """قراءة الملف المرفوع أو أي كائن قابل للقراءة على دفعات"""
+    stream = getattr(source, 'stream', source)
+    while True:
+        chunk = stream.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        yield chunk
+
+
+def hash_file(path):
+    """حساب بصمة SHA-256 لملف على القرص على دفعات"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in _iter_chunks(f):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class BlobStore:
+    """واجهة موحدة لحفظ الملفات المرفوعة بدون تكرار"""
+
+    IMAGE_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp', 'heic', 'heif', 'bmp'}
+
+    @staticmethod
+    def relative_path(digest, extension):
+        """المسار كما يُخزن في قاعدة البيانات"""
+        return f"{BLOB_PREFIX}{digest[:2]}/{digest[2:4]}/{digest}.{extension}"
+
+    @staticmethod
+    def absolute_path(digest, extension):
+        return os.path.join(BLOB_ROOT, digest[:2], digest[2:4], f"{digest}.{extension}")
+
+    @staticmethod
+    def local_path(relative_path):
+        """المسار الكامل على القرص لمسار مخزن في قاعدة البيانات"""
+        return os.path.join(PROJECT_ROOT, relative_path)
+
+    @staticmethod
+    def parse_path(path):
+        """استخراج (البصمة، الامتداد) من مسار ملف في المخزن، أو None"""
+        if not path:
+            return None
+        normalized = path.replace('\\', '/')
+        if normalized.startswith('uploads/blobs/'):
+            normalized = 'static/' + normalized
+        if not normalized.startswith(BLOB_PREFIX):
+            return None
+        name = normalized.rsplit('/', 1)[-1]
+        digest, _, extension = name.partition('.')
+        if len(digest) != 64 or not extension or '.' in extension:
+            return None
+        return digest, extension
+
+    @staticmethod
+    def save(file, filename=None, max_bytes=None):
+        """
+        حفظ ملف مرفوع (FileStorage أو أي كائن قابل للقراءة) في المخزن
+
+        :param file: الملف المرفوع
+        :param filename: اسم الملف الأصلي لتحديد الامتداد (افتراضياً file.filename)
+        :param max_bytes: الحد الأقصى للحجم؛ عند تجاوزه يُرفع ValueError ولا يُحفظ شيء
+        :return: (المسار النسبي، True إذا كان الملف جديداً) أو (None, False) للملف الفارغ
+        """
+        extension = _extension_of(filename or getattr(file, 'filename', None))
+        tmp_path, digest, size = BlobStore._spool(file, max_bytes)
+        try:
+            if size == 0:
+                return None, False
+            return BlobStore.ingest(tmp_path, digest, size, f"file.{extension}")
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    @staticmethod
+    def _spool(file, max_bytes=None):
+        """
+        كتابة الملف المرفوع إلى ملف مؤقت داخل المخزن مع حساب بصمته
+
+        :return: (مسار الملف المؤقت، البصمة، الحجم)؛ حذف الملف المؤقت مسؤولية المستدعي
+        """
+        tmp_dir = os.path.join(BLOB_ROOT, '.tmp')
+        os.makedirs(tmp_dir, exist_ok=True)
+        tmp_path = os.path.join(tmp_dir, uuid.uuid4().hex)
+
+        digest = hashlib.sha256()
+        size = 0
+        try:
+            with open(tmp_path, 'wb') as out:
+                for chunk in _iter_chunks(file):
+                    size += len(chunk)
+                    if max_bytes is not None and size > max_bytes:
+                        raise ValueError(f"حجم الملف يتجاوز الحد المسموح ({max_bytes // (1024 * 1024)}MB)")
+                    digest.update(chunk)
+                    out.write(chunk)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return tmp_path, digest.hexdigest(), size
+
+    @staticmethod
+    def ingest(local_path, digest, size, filename):
+        """
+        نقل ملف مكتوب مسبقاً على القرص (وبصمته محسوبة) إلى المخزن دون إعادة قراءته
+
+        يُستخدم لإنهاء الرفع المجزأ؛ الملف المؤقت يُنقل أو يُحذف إذا كان المحتوى موجوداً.
+        """
+        extension = _extension_of(filename)
+        target = BlobStore.absolute_path(digest, extension)
+        created = not os.path.exists(target)
+        if created:
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            shutil.move(local_path, target)
+        elif os.path.exists(local_path):
+            os.remove(local_path)
+
+        BlobStore._add_reference(digest, extension, size)
+        return BlobStore.relative_path(digest, extension), created
+
+    @staticmethod
+    def save_image(file, filename=None, max_bytes=None, **options):
+        """
+        حفظ صورة مرفوعة بعد تحسينها (الاتجاه والأبعاد) ثم إنشاء نسخها المصغرة في الخلفية
+
+        ملف المخزن لا يُعدّل بعد تخزينه أبداً (اسمه بصمة محتواه)، لذلك يُحسّن الملف المؤقت
+        وتُحسب البصمة للناتج. نفس الصورة المرفوعة مرتين تعطي نفس الناتج فتبقى مكررة واحدة.
+        الملفات غير الصور تُحفظ كما هي.
+
+        :param options: خيارات utils.image_pipeline.optimize_image (max_size، quality، to_jpeg)
+        :return: مثل save
+        """
+        extension = _extension_of(filename or getattr(file, 'filename', None))
+        if extension not in BlobStore.IMAGE_EXTENSIONS:
+            return BlobStore.save(file, filename, max_bytes=max_bytes)
+
+        tmp_path, _, size = BlobStore._spool(file, max_bytes)
+        try:
+            if size == 0:
+                return None, False
+            return BlobStore.ingest_image(tmp_path, f"file.{extension}", **options)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    @staticmethod
+    def ingest_image(local_path, filename, **options):
+        """
+        تحسين صورة مكتوبة على القرص (خارج المخزن) ثم نقلها إلى المخزن
+
+        النسخ المصغرة تُجدول في الخلفية للملفات الجديدة فقط؛ الأصل لا يُلمس بعدها.
+        """
+        from utils.image_pipeline import optimize_image, submit_variants
+
+        optimize_image(local_path, **options)
+        path, created = BlobStore.ingest(local_path, hash_file(local_path), os.path.getsize(local_path),
+                                         filename)
+        if created:
+            submit_variants(BlobStore.local_path(path))
+        return path, created
+
+    @staticmethod
+    def save_bytes(data, extension):
+        """حفظ بيانات ثنائية جاهزة (مثل صورة محولة أو Base64 مفكوك)"""
+        return BlobStore.save(io.BytesIO(data), f"file.{extension}")
+
+    @staticmethod
+    def _add_reference(digest, extension, size):
+        """
+        زيادة عداد المراجع ضمن معاملة الطلب الحالية
+
+        التحديث ذري في قاعدة البيانات، وإنشاء السجل الجديد داخل savepoint حتى لا يُفسد
+        تعارض رفعين متزامنين لنفس الملف معاملة الطلب.
+        """
+        now = datetime.utcnow()
+        updated = FileBlob.query.filter_by(sha256=digest, extension=extension).update(
+            {FileBlob.ref_count: FileBlob.ref_count + 1, FileBlob.last_referenced_at: now},
+            synchronize_session=False
+        )
+        if updated:
+            return
+        try:
+            with db.session.begin_nested():
+                db.session.add(FileBlob(sha256=digest, extension=extension, size=size,
+                                        ref_count=1, created_at=now, last_referenced_at=now))
+        except IntegrityError:
+            FileBlob.query.filter_by(sha256=digest, extension=extension).update(
+                {FileBlob.ref_count: FileBlob.ref_count + 1, FileBlob.last_referenced_at: now},
+                synchronize_session=False
+            )
+
+    @staticmethod
+    def release(path):
+        """إنقاص عداد المراجع عند إزالة المرجع من قاعدة البيانات (الملف نفسه يبقى)"""
+        parsed = BlobStore.parse_path(path)
+        if not parsed:
+            return False
+        digest, extension = parsed
+        FileBlob.query.filter(
+            FileBlob.sha256 == digest,
+            FileBlob.extension == extension,
+            FileBlob.ref_count > 0
+        ).update({FileBlob.ref_count: FileBlob.ref_count - 1}, synchronize_session=False)
+        return True
+
+    @staticmethod
+    def count_references():
+        """
+        عدّ المراجع الفعلية لملفات المخزن من أعمدة النص و JSON في كل الجداول
+
+        :return: Counter {(البصمة، الامتداد): عدد المراجع}
+        """
+        counts = Counter()
+        existing = set(inspect(db.engine).get_table_names())
+        for table in db.metadata.sorted_tables:
+            if table.name in REFERENCE_EXCLUDED_TABLES or table.name not in existing:
+                continue
+            for column in table.columns:
+                if not isinstance(column.type, (String, JSON)) or isinstance(column.type, Enum):
+                    continue
+                value = cast(column, Text)
+                rows = db.session.execute(
+                    select(value).where(value.like('%blobs/%')).execution_options(yield_per=1000))
+                for (text_value,) in rows:
+                    counts.update(_REFERENCE.findall(text_value))
+        return counts
+
+    @staticmethod
+    def collect_garbage(dry_run=True):
+        """
+        حذف الملفات التي لا يشير إليها أي سجل (عملية يدوية فقط)
+
+        المراجع تُعدّ من الجداول (count_references) لا من ref_count، ويُصحح العداد للملفات
+        الباقية عند التنفيذ الفعلي.
+
+        :return: (عدد الملفات، عدد البايتات المستردة)
+        """
+        from utils.image_pipeline import VARIANT_SIZES, variant_name
+
+        references = BlobStore.count_references()
+        cutoff = datetime.utcnow() - GC_GRACE
+        count = reclaimed = 0
+        for blob in FileBlob.query.all():
+            actual = references.get((blob.sha256, blob.extension), 0)
+            recent = max(blob.last_referenced_at or datetime.min, blob.created_at or datetime.min) > cutoff
+            if actual or recent:
+                if actual and not dry_run:
+                    blob.ref_count = actual
+                continue
+            path = BlobStore.absolute_path(blob.sha256, blob.extension)
+            candidates = [path] + [variant_name(path, size) for size in VARIANT_SIZES]
+            for candidate in candidates:
+                if os.path.exists(candidate):
+                    reclaimed += os.path.getsize(candidate)
+                    if not dry_run:
+                        os.remove(candidate)
+            count += 1
+            if not dry_run:
+                db.session.delete(blob)
+        if not dry_run:
+            db.session.commit()
+        return count, reclaimed
+
+    @staticmethod
+    def dedupe_tree(root=UPLOADS_ROOT, dry_run=False):
+        """
+        إزالة التكرار من ملفات مرفوعة سابقاً في مكانها
+
+        الملفات المتطابقة تُستبدل بروابط صلبة (hard links) لنسخة واحدة، فتبقى كل المسارات
+        المخزنة في قاعدة البيانات صالحة دون تعديل. المقارنة بالحجم أولاً ثم بالبصمة.
+
+        :return: قاموس بالإحصائيات (الملفات، المجموعات المكررة، البايتات المستردة، الأخطاء)
+        """
+        by_size = defaultdict(list)
+        scanned = 0
+        for dirpath, dirnames, filenames in os.walk(root):
+            dirnames[:] = [d for d in dirnames if not d.startswith('.')]
+            for name in filenames:
+                path = os.path.join(dirpath, name)
+                if os.path.islink(path):
+                    continue
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                scanned += 1
+                if stat.st_size:
+                    by_size[stat.st_size].append((path, stat))
+
+        report = {'scanned': scanned, 'duplicate_groups': 0, 'duplicates': 0,
+                  'reclaimed_bytes': 0, 'errors': 0}
+
+        for size, entries in by_size.items():
+            if len(entries) < 2:
+                continue
+            by_digest = defaultdict(list)
+            for path, stat in entries:
+                try:
+                    by_digest[hash_file(path)].append((path, stat))
+                except OSError as e:
+                    logger.warning(f"تعذر قراءة {path}: {e}")
+                    report['errors'] += 1
+
+            for group in by_digest.values():
+                if len(group) < 2:
+                    continue
+                keeper_path, keeper_stat = group[0]
+                linked = False
+                for path, stat in group[1:]:
+                    # مرتبط مسبقاً بنفس النسخة
+                    if (stat.st_dev, stat.st_ino) == (keeper_stat.st_dev, keeper_stat.st_ino):
+                        continue
+                    if stat.st_dev != keeper_stat.st_dev:
+                        report['errors'] += 1
+                        continue
+                    report['duplicates'] += 1
+                    report['reclaimed_bytes'] += size
+                    linked = True
+                    if dry_run:
+                        continue
+                    tmp_path = f"{path}.{uuid.uuid4().hex[:8]}.link"
+                    try:
+                        os.link(keeper_path, tmp_path)
+                        os.replace(tmp_path, path)
+                    except OSError as e:
+                        logger.warning(f"تعذر ربط {path}: {e}")
+                        report['errors'] += 1
+                        report['duplicates'] -= 1
+                        report['reclaimed_bytes'] -= size
+                        if os.path.exists(tmp_path):
+                            os.remove(tmp_path)
+                if linked:
+                    report['duplicate_groups'] += 1
+
+        return report
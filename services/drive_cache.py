@@ -0,0 +1,314 @@
+"""
+ذاكرة مشتركة لمعرفات مجلدات Google Drive وبيانات الملفات
+
+الوصول لمجلد بالاسم كان يكلف طلب بحث (وطلب إنشاء أحياناً) لكل جزء من المسار في كل
+عملية رفع. الآن كل (مجلد أب، اسم) يُحل مرة واحدة ويُحفظ في جدول drive_folder_cache
+المشترك بين كل العمليات والرافعين (GoogleDriveService وقائمة المزامنة ومستعرض Drive)،
+مع نسخة في ذاكرة العملية لمدة MEMORY_TTL لتجنب حتى استعلام قاعدة البيانات.
+
+الصلاحية:
+- كل سجل صالح لمدة FOLDER_TTL (مجلدات) أو FILE_TTL (بيانات الملفات وقوائم المجلدات)
+- مهمة دورية تقرأ سجل التغييرات في Drive (changes API) برمز صفحة محفوظ، وتُسقط كل
+  مجلد أو ملف تغيّر (نُقل، أعيدت تسميته، حُذف) مع مجلداته الفرعية وقوائم آبائه
+- رفض Drive لمعرف مخزن (404) يُسقطه فوراً عبر forget
+
+الكتابة تتم في اتصال وعملية حفظ مستقلين عن db.session حتى لا تحفظ تغييرات الطلب الجاري.
+"""
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, insert, select
+from sqlalchemy.exc import IntegrityError
+
+from app import db
+from models import DriveFolderCache, DriveFileCache, DriveCacheState
+
+logger = logging.getLogger(__name__)
+
+FOLDER_TTL = timedelta(days=int(os.environ.get('DRIVE_FOLDER_CACHE_DAYS', 7)))
+FILE_TTL = timedelta(hours=int(os.environ.get('DRIVE_FILE_CACHE_HOURS', 24)))
+
+# مدة بقاء معرف المجلد في ذاكرة العملية (التغييرات من عملية أخرى تظهر بعدها)
+MEMORY_TTL = 300
+
+# (drive_id, parent_id, name) -> (folder_id, وقت الحفظ)
+_memory = {}
+_lock = threading.Lock()
+
+
+def _folders():
+    return DriveFolderCache.__table__
+
+
+def _files():
+    return DriveFileCache.__table__
+
+
+def _state():
+    return DriveCacheState.__table__
+
+
+# ---------------------------------------------------------------------------
+# المجلدات
+# ---------------------------------------------------------------------------
+
+def get_folder(drive_id, parent_id, name):
+    """معرف المجلد المخزن للاسم داخل المجلد الأب، أو None إذا لم يكن مخزناً أو انتهت صلاحيته"""
+    key = (drive_id, parent_id, name)
+    with _lock:
+        entry = _memory.get(key)
+        if entry and time.monotonic() - entry[1] < MEMORY_TTL:
+            return entry[0]
+
+    table = _folders()
+    try:
+        with db.engine.connect() as conn:
+            row = conn.execute(select(table.c.folder_id, table.c.cached_at).where(
+                table.c.drive_id == drive_id, table.c.parent_id == parent_id, table.c.name == name
+            )).first()
+    except Exception as e:
+        logger.warning(f"تعذر قراءة ذاكرة مجلدات Drive: {e}")
+        return None
+
+    if row is None or datetime.utcnow() - row.cached_at > FOLDER_TTL:
+        return None
+    with _lock:
+        _memory[key] = (row.folder_id, time.monotonic())
+    return row.folder_id
+
+
+def put_folder(drive_id, parent_id, name, folder_id):
+    """حفظ معرف مجلد بعد البحث عنه أو إنشائه"""
+    with _lock:
+        _memory[(drive_id, parent_id, name)] = (folder_id, time.monotonic())
+
+    table = _folders()
+    try:
+        with db.engine.begin() as conn:
+            conn.execute(delete(table).where(
+                table.c.drive_id == drive_id, table.c.parent_id == parent_id, table.c.name == name
+            ))
+            conn.execute(insert(table).values(
+                drive_id=drive_id, parent_id=parent_id, name=name,
+                folder_id=folder_id, cached_at=datetime.utcnow()
+            ))
+    except IntegrityError:
+        # عملية أخرى حفظت نفس المسار في نفس اللحظة
+        pass
+    except Exception as e:
+        logger.warning(f"تعذر حفظ مجلد Drive في الذاكرة: {e}")
+
+
+def forget(ids, listings=()):
+    """
+    إسقاط عناصر تغيّرت في Drive
+
+    :param ids: معرفات مجلدات أو ملفات؛ تُسقط هي ومجلداتها الفرعية المعروفة وقوائمها
+    :param listings: معرفات مجلدات تغيّر محتواها فقط (تُسقط قائمة ملفاتها دون معرفها)
+    """
+    ids = {i for i in ids if i}
+    listings = {i for i in listings if i}
+    if not ids and not listings:
+        return
+
+    folders, files, state = _folders(), _files(), _state()
+    try:
+        with db.engine.begin() as conn:
+            # المجلدات الفرعية لمجلد منقول أو محذوف لم تعد صالحة أيضاً
+            frontier = set(ids)
+            while frontier:
+                children = {row.folder_id for row in conn.execute(
+                    select(folders.c.folder_id).where(folders.c.parent_id.in_(frontier)))}
+                frontier = children - ids
+                ids |= children
+
+            if ids:
+                conn.execute(delete(folders).where(
+                    folders.c.folder_id.in_(ids) | folders.c.parent_id.in_(ids)))
+                conn.execute(delete(files).where(files.c.file_id.in_(ids) | files.c.parent_id.in_(ids)))
+            markers = [f'listed:{i}' for i in ids | listings]
+            conn.execute(delete(state).where(state.c.key.in_(markers)))
+    except Exception as e:
+        logger.warning(f"تعذر تحديث ذاكرة Drive: {e}")
+
+    with _lock:
+        changed = True
+        while changed:
+            changed = False
+            for key, (folder_id, _) in list(_memory.items()):
+                if folder_id in ids or key[1] in ids:
+                    ids.add(folder_id)
+                    del _memory[key]
+                    changed = True
+
+
+def clear():
+    """مسح الذاكرة بالكامل"""
+    with _lock:
+        _memory.clear()
+    with db.engine.begin() as conn:
+        for table in (_folders(), _files(), _state()):
+            conn.execute(delete(table))
+
+
+# ---------------------------------------------------------------------------
+# بيانات الملفات وقوائم المجلدات
+# ---------------------------------------------------------------------------
+
+def _file_values(drive_id, item, parent_id=None):
+    parents = item.get('parents') or []
+    size = item.get('size')
+    return {
+        'file_id': item['id'],
+        'drive_id': drive_id,
+        'parent_id': parent_id or (parents[0] if parents else None),
+        'name': item.get('name'),
+        'mime_type': item.get('mimeType'),
+        'size': int(size) if size is not None else None,
+        'web_view_link': item.get('webViewLink'),
+        'web_content_link': item.get('webContentLink'),
+        'modified_time': item.get('modifiedTime'),
+        'cached_at': datetime.utcnow(),
+    }
+
+
+def _file_dict(row):
+    return {
+        'id': row.file_id,
+        'name': row.name,
+        'mimeType': row.mime_type,
+        'size': row.size,
+        'webViewLink': row.web_view_link,
+        'webContentLink': row.web_content_link,
+        'modifiedTime': row.modified_time,
+        'parents': [row.parent_id] if row.parent_id else [],
+    }
+
+
+def put_files(drive_id, items, parent_id=None):
+    """حفظ بيانات ملفات كما تعيدها واجهة Drive (id, name, mimeType, webViewLink...)"""
+    rows = [_file_values(drive_id, item, parent_id) for item in items if item and item.get('id')]
+    if not rows:
+        return
+    table = _files()
+    try:
+        with db.engine.begin() as conn:
+            conn.execute(delete(table).where(table.c.file_id.in_([row['file_id'] for row in rows])))
+            conn.execute(insert(table), rows)
+    except Exception as e:
+        logger.warning(f"تعذر حفظ بيانات ملفات Drive: {e}")
+
+
+def get_file(file_id):
+    """بيانات ملف مخزنة وصالحة، أو None"""
+    table = _files()
+    try:
+        with db.engine.connect() as conn:
+            row = conn.execute(select(table).where(table.c.file_id == file_id)).first()
+    except Exception as e:
+        logger.warning(f"تعذر قراءة بيانات ملف Drive: {e}")
+        return None
+    if row is None or datetime.utcnow() - row.cached_at > FILE_TTL:
+        return None
+    return _file_dict(row)
+
+
+def file_metadata(client, file_id):
+    """بيانات ملف من الذاكرة، أو من Drive عند غيابها (ثم تُحفظ)"""
+    cached = get_file(file_id)
+    if cached is not None:
+        return cached
+    item = client.get_file(file_id)
+    if item:
+        put_files(client.namespace, [item])
+    return item
+
+
+def _get_state(conn, key):
+    table = _state()
+    return conn.execute(select(table.c.value, table.c.updated_at).where(table.c.key == key)).first()
+
+
+def _set_state(conn, key, value):
+    table = _state()
+    conn.execute(delete(table).where(table.c.key == key))
+    conn.execute(insert(table).values(key=key, value=value, updated_at=datetime.utcnow()))
+
+
+def list_folder(client, folder_id, refresh=False):
+    """
+    محتوى مجلد (ملفات ومجلدات فرعية) من الذاكرة إذا جُلب خلال FILE_TTL ولم يتغير،
+    وإلا من Drive باستدعاء list واحد (مع الصفحات) ثم يُحفظ
+    """
+    files = _files()
+    marker = f'listed:{folder_id}'
+    if not refresh:
+        try:
+            with db.engine.connect() as conn:
+                listed = _get_state(conn, marker)
+                if listed is not None and datetime.utcnow() - listed.updated_at <= FILE_TTL:
+                    rows = conn.execute(select(files).where(files.c.parent_id == folder_id)
+                                        .order_by(files.c.name)).all()
+                    return [_file_dict(row) for row in rows]
+        except Exception as e:
+            logger.warning(f"تعذر قراءة قائمة مجلد Drive: {e}")
+
+    items = client.list_folder(folder_id)
+    rows = [_file_values(client.namespace, item, folder_id) for item in items]
+    try:
+        stale = files.c.parent_id == folder_id
+        if rows:
+            stale = stale | files.c.file_id.in_([row['file_id'] for row in rows])
+        with db.engine.begin() as conn:
+            conn.execute(delete(files).where(stale))
+            if rows:
+                conn.execute(insert(files), rows)
+            _set_state(conn, marker, str(len(rows)))
+    except Exception as e:
+        logger.warning(f"تعذر حفظ قائمة مجلد Drive: {e}")
+    return sorted(items, key=lambda item: item.get('name') or '')
+
+
+# ---------------------------------------------------------------------------
+# سجل التغييرات
+# ---------------------------------------------------------------------------
+
+def sync_changes(client):
+    """
+    قراءة التغييرات في Drive منذ آخر مرة وإسقاط ما تغيّر من الذاكرة
+
+    أول استدعاء يحفظ رمز البداية فقط. العمليات المتعددة قد تقرأ نفس الصفحة، والإسقاط
+    المكرر لا يضر.
+
+    :return: عدد العناصر المتغيرة
+    """
+    key = f'page_token:{client.namespace}'
+    with db.engine.connect() as conn:
+        saved = _get_state(conn, key)
+
+    if saved is None or not saved.value:
+        token = client.start_page_token()
+        with db.engine.begin() as conn:
+            _set_state(conn, key, token)
+        return 0
+
+    token, changed, parents = saved.value, set(), set()
+    while True:
+        changes, next_token, new_start_token = client.list_changes(token)
+        for change in changes:
+            changed.add(change.get('fileId'))
+            parents.update((change.get('file') or {}).get('parents') or [])
+        if new_start_token:
+            token = new_start_token
+            break
+        token = next_token
+
+    forget(changed, listings=parents)
+    with db.engine.begin() as conn:
+        _set_state(conn, key, token)
+    if changed:
+        logger.info(f"ذاكرة Drive: تم إسقاط {len(changed)} عنصر متغير")
+    return len(changed)
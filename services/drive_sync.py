@@ -0,0 +1,844 @@
+"""
+قائمة المزامنة الصادرة إلى Google Drive
+
+الطلب يحفظ الملف محلياً ويسجل صفاً في drive_sync_jobs ثم يعود فوراً؛ الرفع يتم في
+الخلفية بنفس أسلوب قائمة الإيميلات (services/email_queue.py):
+
+- عامل يحجز دفعة من الملفات المستحقة ويوزعها على عدد محدود من الخيوط (DRIVE_SYNC_WORKERS)
+- مسار المجلد يُخزن كأسماء (طلبات الموظفين / الفواتير / ...) ويُحوَّل إلى معرف عبر
+  ذاكرة المجلدات المشتركة (services/drive_cache.py)، فلا يُبحث عن نفس المجلد لكل ملف
+- الرفع قابل للاستئناف (Drive resumable upload) على دفعات CHUNK_SIZE، ورابط الجلسة
+  والإزاحة يُحفظان بعد كل دفعة: المحاولة التالية تكمل من حيث توقفت حتى بعد إعادة التشغيل
+- الفشل المؤقت (شبكة، 429، 5xx) يعاد بتأخير أسي، والدائم (ملف مفقود، طلب مرفوض) يتوقف
+
+بعد الرفع تُكتب الروابط في السجل المرتبط (الفاتورة، صور الغسيل والفحص، سجلات السيارات).
+للتجربة دون Drive حقيقي يكفي FakeDriveClient:
+    from services.drive_sync import sync_due, FakeDriveClient
+    sync_due(client=FakeDriveClient())
+"""
+import json
+import logging
+import mimetypes
+import os
+import random
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import requests
+from flask import current_app
+from requests.adapters import HTTPAdapter
+from sqlalchemy import and_, event, func, or_
+from sqlalchemy.orm import Session
+
+from app import db
+from models import DriveSyncJob
+from services import drive_cache
+
+logger = logging.getLogger(__name__)
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+STATUS_PENDING = 'pending'
+STATUS_UPLOADING = 'uploading'
+STATUS_DONE = 'done'
+STATUS_FAILED = 'failed'
+
+STATUS_LABELS = {
+    STATUS_PENDING: 'بانتظار الرفع',
+    STATUS_UPLOADING: 'جاري الرفع',
+    STATUS_DONE: 'تم الرفع',
+    STATUS_FAILED: 'فشل',
+}
+
+BATCH_SIZE = int(os.environ.get('DRIVE_SYNC_BATCH_SIZE', 20))
+WORKERS = int(os.environ.get('DRIVE_SYNC_WORKERS', 3))
+
+# حجم دفعة الرفع يجب أن يكون من مضاعفات 256KB حسب واجهة Drive
+CHUNK_SIZE = max(int(os.environ.get('DRIVE_SYNC_CHUNK_MB', 8)), 1) * 1024 * 1024
+
+# الملف المحجوز لعامل توقف دون تسجيل النتيجة يعود للقائمة بعد هذه المدة
+LOCK_TIMEOUT = timedelta(minutes=30)
+
+BACKOFF_BASE = 60
+BACKOFF_MAX = 6 * 3600
+
+_SESSION_KEY = 'drive_sync_enqueued'
+
+
+class DriveError(Exception):
+    """خطأ من واجهة Drive مع رمز الحالة"""
+
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status
+
+
+class PermanentSyncError(Exception):
+    """فشل لن تصلحه إعادة المحاولة"""
+
+
+class FolderGoneError(DriveError):
+    """مجلد الرفع المحفوظ في السجل لم يعد موجوداً في Drive (يُعاد حله في المحاولة التالية)"""
+
+
+def backoff_delay(attempts):
+    """التأخير قبل المحاولة التالية بالثواني: أسي مع تذبذب عشوائي ±20%"""
+    delay = min(BACKOFF_BASE * (2 ** max(attempts - 1, 0)), BACKOFF_MAX)
+    return delay * random.uniform(0.8, 1.2)
+
+
+def _escape_query(value):
+    return value.replace('\\', '\\\\').replace("'", "\\'")
+
+
+# ---------------------------------------------------------------------------
+# عملاء Drive
+# ---------------------------------------------------------------------------
+
+class DriveClient:
+    """واجهة Drive v3 عبر HTTP بجلسة مشتركة وتوكن مخزن مؤقتاً"""
+
+    API_URL = 'https://www.googleapis.com/drive/v3/files'
+    UPLOAD_URL = 'https://www.googleapis.com/upload/drive/v3/files'
+    CHANGES_URL = 'https://www.googleapis.com/drive/v3/changes'
+    FILE_FIELDS = 'id,name,webViewLink,webContentLink'
+    TOKEN_TTL = timedelta(minutes=45)
+
+    _session = None
+    _token = None
+    _token_at = None
+    _lock = threading.Lock()
+
+    def __init__(self, drive_service=None, timeout=60):
+        if drive_service is None:
+            from utils.google_drive_service import drive_service
+        self.drive_service = drive_service
+        self.timeout = timeout
+        self.root_folder_id = drive_service.get_root_folder()
+        self.namespace = drive_service.shared_drive_id
+
+    @classmethod
+    def session(cls):
+        with cls._lock:
+            if cls._session is None:
+                session = requests.Session()
+                session.mount('https://', HTTPAdapter(pool_connections=2, pool_maxsize=max(WORKERS, 1)))
+                cls._session = session
+            return cls._session
+
+    def _access_token(self, refresh=False):
+        cls = type(self)
+        with cls._lock:
+            expired = cls._token_at is None or datetime.utcnow() - cls._token_at > self.TOKEN_TTL
+            if refresh or expired or not cls._token:
+                if not self.drive_service.authenticate():
+                    raise DriveError('فشلت المصادقة مع Google Drive')
+                cls._token = self.drive_service.access_token
+                cls._token_at = datetime.utcnow()
+            return cls._token
+
+    def _request(self, method, url, headers=None, **kwargs):
+        for attempt in range(2):
+            all_headers = dict(headers or {})
+            all_headers['Authorization'] = f'Bearer {self._access_token(refresh=bool(attempt))}'
+            response = self.session().request(method, url, headers=all_headers, timeout=self.timeout, **kwargs)
+            if response.status_code != 401:
+                return response
+        return response
+
+    @staticmethod
+    def _raise_for(response, action):
+        status = response.status_code
+        message = f'{action}: Drive {status} {response.text[:300]}'
+        if status in (400, 413) or (status == 403 and 'ateLimitExceeded' not in response.text):
+            raise PermanentSyncError(message)
+        raise DriveError(message, status)
+
+    def find_folder(self, name, parent_id):
+        query = (f"name='{_escape_query(name)}' and mimeType='application/vnd.google-apps.folder' "
+                 f"and trashed=false and '{parent_id}' in parents")
+        response = self._request('GET', self.API_URL, params={
+            'q': query,
+            'fields': 'files(id)',
+            'pageSize': 1,
+            'supportsAllDrives': 'true',
+            'includeItemsFromAllDrives': 'true',
+            'corpora': 'drive',
+            'driveId': self.drive_service.shared_drive_id,
+        })
+        if response.status_code != 200:
+            self._raise_for(response, 'البحث عن مجلد')
+        files = response.json().get('files', [])
+        return files[0]['id'] if files else None
+
+    def create_folder(self, name, parent_id):
+        response = self._request('POST', self.API_URL, params={'supportsAllDrives': 'true', 'fields': 'id'}, json={
+            'name': name,
+            'mimeType': 'application/vnd.google-apps.folder',
+            'parents': [parent_id],
+        })
+        if response.status_code not in (200, 201):
+            self._raise_for(response, 'إنشاء مجلد')
+        return response.json()['id']
+
+    def list_folder(self, folder_id):
+        """محتوى مجلد (كل الصفحات)"""
+        items, page_token = [], None
+        while True:
+            params = {
+                'q': f"'{folder_id}' in parents and trashed=false",
+                'fields': f'nextPageToken,files({self.FILE_FIELDS},mimeType,size,modifiedTime,parents)',
+                'pageSize': 1000,
+                'supportsAllDrives': 'true',
+                'includeItemsFromAllDrives': 'true',
+                'corpora': 'drive',
+                'driveId': self.drive_service.shared_drive_id,
+            }
+            if page_token:
+                params['pageToken'] = page_token
+            response = self._request('GET', self.API_URL, params=params)
+            if response.status_code != 200:
+                self._raise_for(response, 'عرض مجلد')
+            data = response.json()
+            items.extend(data.get('files', []))
+            page_token = data.get('nextPageToken')
+            if not page_token:
+                return items
+
+    def get_file(self, file_id):
+        response = self._request('GET', f'{self.API_URL}/{file_id}', params={
+            'fields': f'{self.FILE_FIELDS},mimeType,size,modifiedTime,parents',
+            'supportsAllDrives': 'true',
+        })
+        if response.status_code == 404:
+            return None
+        if response.status_code != 200:
+            self._raise_for(response, 'بيانات ملف')
+        return response.json()
+
+    def start_page_token(self):
+        """رمز بداية سجل التغييرات في Drive المشترك"""
+        response = self._request('GET', f'{self.CHANGES_URL}/startPageToken', params={
+            'driveId': self.drive_service.shared_drive_id,
+            'supportsAllDrives': 'true',
+        })
+        if response.status_code != 200:
+            self._raise_for(response, 'رمز التغييرات')
+        return response.json()['startPageToken']
+
+    def list_changes(self, page_token):
+        """
+        صفحة من سجل التغييرات
+
+        :return: (التغييرات، رمز الصفحة التالية، رمز البداية الجديد عند آخر صفحة)
+        """
+        response = self._request('GET', self.CHANGES_URL, params={
+            'pageToken': page_token,
+            'driveId': self.drive_service.shared_drive_id,
+            'supportsAllDrives': 'true',
+            'includeItemsFromAllDrives': 'true',
+            'pageSize': 1000,
+            'fields': 'nextPageToken,newStartPageToken,changes(fileId,removed,file(parents))',
+        })
+        if response.status_code != 200:
+            self._raise_for(response, 'سجل التغييرات')
+        data = response.json()
+        return data.get('changes', []), data.get('nextPageToken'), data.get('newStartPageToken')
+
+    def start_upload(self, name, parent_id, mime_type, size):
+        """بدء جلسة رفع قابلة للاستئناف وإرجاع رابطها"""
+        response = self._request(
+            'POST', self.UPLOAD_URL,
+            params={'uploadType': 'resumable', 'supportsAllDrives': 'true', 'fields': self.FILE_FIELDS},
+            headers={'X-Upload-Content-Type': mime_type, 'X-Upload-Content-Length': str(size)},
+            json={'name': name, 'parents': [parent_id]},
+        )
+        if response.status_code != 200 or not response.headers.get('Location'):
+            self._raise_for(response, 'بدء الرفع')
+        return response.headers['Location']
+
+    @staticmethod
+    def _committed_offset(response):
+        # Range: bytes=0-1048575 تعني أن Drive استلم حتى البايت 1048575
+        committed = response.headers.get('Range')
+        if not committed:
+            return 0
+        return int(committed.rsplit('-', 1)[1]) + 1
+
+    def upload_chunk(self, upload_uri, data, offset, total):
+        """
+        رفع دفعة من الإزاحة offset
+
+        :return: (الإزاحة التي استلمها Drive، بيانات الملف عند اكتمال الرفع أو None)
+        """
+        if total == 0:
+            content_range = 'bytes */0'
+        else:
+            content_range = f'bytes {offset}-{offset + len(data) - 1}/{total}'
+        response = self.session().put(upload_uri, data=data, headers={'Content-Range': content_range},
+                                      timeout=self.timeout)
+        if response.status_code in (200, 201):
+            return total, response.json()
+        if response.status_code == 308:
+            return self._committed_offset(response), None
+        self._raise_for(response, 'رفع دفعة')
+
+    def upload_status(self, upload_uri, total):
+        """
+        الإزاحة التي استلمها Drive في جلسة سابقة
+
+        :return: (الإزاحة، بيانات الملف إن اكتمل) أو (None, None) إذا انتهت صلاحية الجلسة
+        """
+        response = self.session().put(upload_uri, headers={'Content-Range': f'bytes */{total}'},
+                                      timeout=self.timeout)
+        if response.status_code in (200, 201):
+            return total, response.json()
+        if response.status_code == 308:
+            return self._committed_offset(response), None
+        if response.status_code in (404, 410):
+            return None, None
+        self._raise_for(response, 'حالة الرفع')
+
+
+class FakeDriveClient:
+    """Drive في الذاكرة بنفس واجهة DriveClient (للاختبار والتجربة دون اتصال)"""
+
+    def __init__(self, fail_chunks=0):
+        self.root_folder_id = 'fake-root'
+        self.namespace = f'fake-{id(self)}'
+        self.folders = {}
+        self.files = {}
+        self.sessions = {}
+        self.changes = []
+        self.calls = {'find_folder': 0, 'create_folder': 0, 'start_upload': 0, 'upload_chunk': 0,
+                      'list_folder': 0}
+        # عدد الدفعات التالية التي تفشل بخطأ مؤقت (لتجربة الاستئناف وإعادة المحاولة)
+        self.fail_chunks = fail_chunks
+        self._lock = threading.Lock()
+
+    def find_folder(self, name, parent_id):
+        with self._lock:
+            self.calls['find_folder'] += 1
+            return self.folders.get((parent_id, name))
+
+    def create_folder(self, name, parent_id):
+        with self._lock:
+            self.calls['create_folder'] += 1
+            if (parent_id, name) not in self.folders:
+                self.folders[(parent_id, name)] = f'folder-{uuid.uuid4().hex[:12]}'
+                self.changes.append({'fileId': self.folders[(parent_id, name)], 'file': {'parents': [parent_id]}})
+            return self.folders[(parent_id, name)]
+
+    def start_upload(self, name, parent_id, mime_type, size):
+        with self._lock:
+            self.calls['start_upload'] += 1
+            if parent_id != self.root_folder_id and parent_id not in self.folders.values():
+                raise DriveError('المجلد غير موجود', 404)
+            upload_uri = f'fake://upload/{uuid.uuid4().hex}'
+            self.sessions[upload_uri] = {'name': name, 'parent': parent_id, 'mime_type': mime_type,
+                                         'size': size, 'data': bytearray()}
+            return upload_uri
+
+    def _finish(self, upload_uri):
+        upload = self.sessions.pop(upload_uri)
+        file_id = f'file-{uuid.uuid4().hex[:12]}'
+        self.files[file_id] = upload
+        self.changes.append({'fileId': file_id, 'file': {'parents': [upload['parent']]}})
+        return self._file_info(file_id)
+
+    def _file_info(self, file_id):
+        upload = self.files[file_id]
+        return {'id': file_id, 'name': upload['name'], 'mimeType': upload['mime_type'],
+                'size': str(len(upload['data'])), 'parents': [upload['parent']],
+                'webViewLink': f'https://drive.google.com/file/d/{file_id}/view',
+                'webContentLink': f'https://drive.google.com/uc?id={file_id}&export=download'}
+
+    def upload_chunk(self, upload_uri, data, offset, total):
+        with self._lock:
+            self.calls['upload_chunk'] += 1
+            upload = self.sessions.get(upload_uri)
+            if upload is None:
+                raise DriveError('جلسة الرفع غير موجودة', 404)
+            if self.fail_chunks > 0:
+                self.fail_chunks -= 1
+                raise DriveError('خطأ مؤقت مصطنع', 503)
+            if offset != len(upload['data']):
+                return len(upload['data']), None
+            upload['data'].extend(data)
+            if len(upload['data']) >= total:
+                return total, self._finish(upload_uri)
+            return len(upload['data']), None
+
+    def upload_status(self, upload_uri, total):
+        with self._lock:
+            upload = self.sessions.get(upload_uri)
+            if upload is None:
+                return None, None
+            return len(upload['data']), None
+
+    def list_folder(self, folder_id):
+        with self._lock:
+            self.calls['list_folder'] += 1
+            items = [{'id': child_id, 'name': name, 'mimeType': 'application/vnd.google-apps.folder',
+                      'parents': [parent_id]}
+                     for (parent_id, name), child_id in self.folders.items() if parent_id == folder_id]
+            items += [self._file_info(file_id) for file_id, upload in self.files.items()
+                      if upload['parent'] == folder_id]
+            return items
+
+    def get_file(self, file_id):
+        with self._lock:
+            return self._file_info(file_id) if file_id in self.files else None
+
+    def start_page_token(self):
+        with self._lock:
+            return str(len(self.changes))
+
+    def list_changes(self, page_token):
+        with self._lock:
+            return self.changes[int(page_token):], None, str(len(self.changes))
+
+    def rename_folder(self, folder_id, new_name):
+        """محاكاة تعديل من خارج النظام (يظهر في سجل التغييرات)"""
+        with self._lock:
+            for (parent_id, name), child_id in list(self.folders.items()):
+                if child_id == folder_id:
+                    del self.folders[(parent_id, name)]
+                    self.folders[(parent_id, new_name)] = folder_id
+                    self.changes.append({'fileId': folder_id, 'file': {'parents': [parent_id]}})
+
+    def delete_folder(self, folder_id):
+        """محاكاة حذف مجلد من خارج النظام"""
+        with self._lock:
+            for key, child_id in list(self.folders.items()):
+                if child_id == folder_id:
+                    del self.folders[key]
+                    self.changes.append({'fileId': folder_id, 'removed': True})
+
+    def expire_sessions(self):
+        with self._lock:
+            self.sessions.clear()
+
+
+def configured_client():
+    """عميل Drive الحقيقي إذا كانت بيانات الاعتماد مضبوطة، وإلا None"""
+    from utils.google_drive_service import drive_service
+    if not drive_service.is_configured():
+        return None
+    return DriveClient(drive_service)
+
+
+# ---------------------------------------------------------------------------
+# حل المجلدات
+# ---------------------------------------------------------------------------
+
+_folder_lock = threading.Lock()
+
+
+def resolve_folder(client, names):
+    """
+    تحويل مسار مجلدات (أسماء من المجلد الرئيسي) إلى معرف المجلد الأخير، مع إنشاء الناقص
+
+    المعرفات تُقرأ من الذاكرة المشتركة (services/drive_cache.py)؛ البحث والإنشاء في
+    Drive يتم تحت قفل حتى لا تنشئ خيوط متوازية نفس المجلد مرتين.
+    """
+    parent_id = client.root_folder_id
+    for name in names:
+        folder_id = drive_cache.get_folder(client.namespace, parent_id, name)
+        if folder_id is None:
+            with _folder_lock:
+                folder_id = drive_cache.get_folder(client.namespace, parent_id, name)
+                if folder_id is None:
+                    folder_id = client.find_folder(name, parent_id) or client.create_folder(name, parent_id)
+                    drive_cache.put_folder(client.namespace, parent_id, name, folder_id)
+        parent_id = folder_id
+    return parent_id
+
+
+# ---------------------------------------------------------------------------
+# السجلات المرتبطة
+# ---------------------------------------------------------------------------
+
+def _model_for(target_type):
+    from models import (InvoiceRequest, CarWashMedia, CarInspectionMedia,
+                        VehicleWorkshop, VehicleHandover, VehicleExternalSafetyCheck)
+    return {
+        'invoice': InvoiceRequest,
+        'car_wash_media': CarWashMedia,
+        'car_inspection_media': CarInspectionMedia,
+        'vehicle_workshop': VehicleWorkshop,
+        'vehicle_handover': VehicleHandover,
+        'vehicle_safety': VehicleExternalSafetyCheck,
+    }.get(target_type)
+
+
+VEHICLE_TARGETS = ('vehicle_workshop', 'vehicle_handover', 'vehicle_safety')
+
+
+def _refresh_vehicle_record(record, target_type):
+    """تجميع نتائج كل ملفات سجل السيارة في حقول Drive الخاصة به"""
+    jobs = DriveSyncJob.query.filter_by(target_type=target_type, target_id=record.id).order_by(DriveSyncJob.id).all()
+    if not jobs:
+        return
+    statuses = {job.status for job in jobs}
+    record.drive_folder_id = next((job.drive_folder_id for job in jobs if job.drive_folder_id), record.drive_folder_id)
+    pdf_links = [job.drive_view_url for job in jobs if job.role == 'pdf' and job.status == STATUS_DONE]
+    if pdf_links:
+        record.drive_pdf_link = pdf_links[-1]
+    image_links = [job.drive_view_url for job in jobs if job.role == 'image' and job.status == STATUS_DONE]
+    if image_links:
+        record.drive_images_links = json.dumps(image_links)
+
+    if statuses == {STATUS_DONE}:
+        record.drive_upload_status = 'success'
+        record.drive_uploaded_at = datetime.utcnow()
+    elif statuses & {STATUS_PENDING, STATUS_UPLOADING}:
+        record.drive_upload_status = 'pending'
+    else:
+        record.drive_upload_status = 'failed'
+
+
+def _on_folder(job):
+    """ربط مجلد Drive بطلب الموظف عند أول ملف"""
+    if not job.employee_request_id:
+        return
+    from models import EmployeeRequest
+    emp_request = db.session.get(EmployeeRequest, job.employee_request_id)
+    if emp_request is not None and emp_request.google_drive_folder_id != job.drive_folder_id:
+        emp_request.google_drive_folder_id = job.drive_folder_id
+        emp_request.google_drive_folder_url = f"https://drive.google.com/drive/folders/{job.drive_folder_id}"
+
+
+def _on_progress(job):
+    if job.target_type == 'car_inspection_media':
+        media = db.session.get(_model_for(job.target_type), job.target_id)
+        if media is not None:
+            media.upload_status = 'uploading'
+            media.upload_progress = job_progress(job)
+
+
+def _on_finished(job):
+    """كتابة نتيجة الرفع (نجاحاً أو فشلاً نهائياً) في السجل المرتبط"""
+    model = _model_for(job.target_type)
+    record = db.session.get(model, job.target_id) if model else None
+    if record is None:
+        return
+
+    if job.target_type in VEHICLE_TARGETS:
+        _refresh_vehicle_record(record, job.target_type)
+        return
+
+    if job.target_type == 'car_inspection_media':
+        record.upload_status = 'completed' if job.status == STATUS_DONE else 'failed'
+        record.upload_progress = job_progress(job)
+
+    if job.status == STATUS_DONE:
+        record.drive_file_id = job.drive_file_id
+        record.drive_view_url = job.drive_view_url
+        record.drive_download_url = job.drive_download_url
+        record.file_size = job.file_size
+
+
+# ---------------------------------------------------------------------------
+# الإضافة والحالة
+# ---------------------------------------------------------------------------
+
+def enqueue(local_path, folder_path, target_type, target_id, file_name=None, role=None,
+            employee_request_id=None, delete_after=False):
+    """
+    تسجيل ملف محلي للرفع (الحفظ مسؤولية المستدعي؛ استدعِ schedule_sync بعد commit)
+
+    :param local_path: مسار الملف نسبة لجذر المشروع (مثل static/uploads/invoices/x.jpg)
+    :param folder_path: أسماء المجلدات من المجلد الرئيسي في Drive
+    :return: سجل DriveSyncJob (نفس السجل إذا كان الملف مسجلاً مسبقاً لنفس الهدف)
+    """
+    existing = DriveSyncJob.query.filter_by(
+        target_type=target_type, target_id=target_id, local_path=local_path
+    ).first()
+    if existing is not None:
+        if existing.status == STATUS_FAILED:
+            retry(existing)
+        return existing
+
+    full_path = os.path.join(PROJECT_ROOT, local_path)
+    file_name = file_name or os.path.basename(local_path)
+    job = DriveSyncJob(
+        local_path=local_path,
+        file_name=file_name,
+        mime_type=mimetypes.guess_type(file_name)[0] or 'application/octet-stream',
+        file_size=os.path.getsize(full_path) if os.path.exists(full_path) else 0,
+        folder_path=json.dumps(list(folder_path), ensure_ascii=False),
+        delete_after=delete_after,
+        target_type=target_type,
+        target_id=target_id,
+        role=role,
+        employee_request_id=employee_request_id,
+        status=STATUS_PENDING,
+        next_attempt_at=datetime.utcnow(),
+    )
+    db.session.add(job)
+    # العامل يبدأ بعد commit حتى يرى الصف الجديد
+    db.session.info[_SESSION_KEY] = True
+    return job
+
+
+def retry(job):
+    """إعادة ملف فاشل إلى القائمة (يستأنف من آخر إزاحة إن كانت الجلسة ما زالت صالحة)"""
+    db.session.info[_SESSION_KEY] = True
+    job.status = STATUS_PENDING
+    job.attempts = 0
+    job.next_attempt_at = datetime.utcnow()
+    job.locked_until = None
+    job.last_error = None
+
+
+def job_progress(job):
+    if job.status == STATUS_DONE:
+        return 100
+    if not job.file_size:
+        return 0
+    return min(int(job.bytes_uploaded * 100 / job.file_size), 99)
+
+
+def to_dict(job):
+    return {
+        'id': job.id,
+        'file_name': job.file_name,
+        'status': job.status,
+        'status_display': STATUS_LABELS.get(job.status, job.status),
+        'progress': job_progress(job),
+        'bytes_uploaded': job.bytes_uploaded,
+        'file_size': job.file_size,
+        'attempts': job.attempts,
+        'next_attempt_at': job.next_attempt_at.isoformat() if job.status == STATUS_PENDING and job.next_attempt_at else None,
+        'last_error': job.last_error,
+        'drive_file_id': job.drive_file_id,
+        'drive_url': job.drive_view_url,
+        'created_at': job.created_at.isoformat() if job.created_at else None,
+        'completed_at': job.completed_at.isoformat() if job.completed_at else None,
+    }
+
+
+def jobs_for_request(employee_request_id):
+    return DriveSyncJob.query.filter_by(employee_request_id=employee_request_id).order_by(DriveSyncJob.id).all()
+
+
+def status_counts():
+    rows = db.session.query(DriveSyncJob.status, func.count(DriveSyncJob.id)).group_by(DriveSyncJob.status).all()
+    counts = {status: 0 for status in STATUS_LABELS}
+    counts.update(dict(rows))
+    return counts
+
+
+# ---------------------------------------------------------------------------
+# العامل
+# ---------------------------------------------------------------------------
+
+_sync_lock = threading.Lock()
+_scheduled = threading.Event()
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='drive-sync')
+
+
+def claim_batch(limit=BATCH_SIZE):
+    """حجز دفعة من الملفات المستحقة لهذا العامل وإرجاع معرفاتها"""
+    now = datetime.utcnow()
+    query = DriveSyncJob.query.filter(or_(
+        and_(DriveSyncJob.status == STATUS_PENDING,
+             or_(DriveSyncJob.next_attempt_at.is_(None), DriveSyncJob.next_attempt_at <= now)),
+        and_(DriveSyncJob.status == STATUS_UPLOADING, DriveSyncJob.locked_until < now)
+    )).order_by(DriveSyncJob.next_attempt_at.asc()).limit(limit)
+    if db.engine.dialect.name == 'postgresql':
+        query = query.with_for_update(skip_locked=True)
+
+    jobs = query.all()
+    for job in jobs:
+        job.status = STATUS_UPLOADING
+        job.locked_until = now + LOCK_TIMEOUT
+        job.attempts = (job.attempts or 0) + 1
+    job_ids = [job.id for job in jobs]
+    db.session.commit()
+    return job_ids
+
+
+def _upload(job, client):
+    """رفع ملف واحد مع الاستئناف، وحفظ التقدم بعد كل دفعة"""
+    path = os.path.join(PROJECT_ROOT, job.local_path)
+    if not os.path.exists(path):
+        raise PermanentSyncError(f'الملف المحلي غير موجود: {job.local_path}')
+    total = os.path.getsize(path)
+    job.file_size = total
+
+    if not job.drive_folder_id:
+        job.drive_folder_id = resolve_folder(client, json.loads(job.folder_path))
+        _on_folder(job)
+        db.session.commit()
+
+    offset, file_info = 0, None
+    if job.upload_uri:
+        offset, file_info = client.upload_status(job.upload_uri, total)
+        if offset is None:
+            # انتهت صلاحية الجلسة (أسبوع في Drive): البدء من جديد
+            job.upload_uri, offset = None, 0
+
+    if file_info is None and not job.upload_uri:
+        try:
+            job.upload_uri = client.start_upload(job.file_name, job.drive_folder_id, job.mime_type, total)
+        except DriveError as e:
+            if e.status == 404:
+                # المجلد حُذف من Drive: يُسقط من الذاكرة، ويُمسح من السجل بعد التراجع
+                drive_cache.forget([job.drive_folder_id])
+                raise FolderGoneError(str(e), e.status) from e
+            raise
+        job.bytes_uploaded = 0
+        db.session.commit()
+
+    with open(path, 'rb') as f:
+        while file_info is None:
+            f.seek(offset)
+            data = f.read(CHUNK_SIZE)
+            offset, file_info = client.upload_chunk(job.upload_uri, data, offset, total)
+            job.bytes_uploaded = offset
+            _on_progress(job)
+            db.session.commit()
+    return file_info
+
+
+def _process_job(app, job_id, client):
+    """رفع ملف محجوز وتسجيل نتيجته (في خيط مستقل بجلسة قاعدة بيانات خاصة به)"""
+    with app.app_context():
+        try:
+            job = db.session.get(DriveSyncJob, job_id)
+            if job is None:
+                return None
+            error, permanent, folder_gone = None, False, False
+            try:
+                file_info = _upload(job, client)
+            except PermanentSyncError as e:
+                error, permanent = str(e), True
+            except FolderGoneError as e:
+                error, folder_gone = str(e), True
+            except Exception as e:
+                error = str(e) or type(e).__name__
+
+            if error is not None:
+                db.session.rollback()
+                job = db.session.get(DriveSyncJob, job_id)
+                if folder_gone:
+                    # التراجع أعاد المعرف المحفوظ: المحاولة التالية تحل المسار من جديد
+                    job.drive_folder_id = None
+                    job.upload_uri = None
+                    job.bytes_uploaded = 0
+                job.locked_until = None
+                job.last_error = error[:2000]
+                if permanent or job.attempts >= job.max_attempts:
+                    job.status = STATUS_FAILED
+                    _on_finished(job)
+                    outcome = 'failed'
+                else:
+                    job.status = STATUS_PENDING
+                    job.next_attempt_at = datetime.utcnow() + timedelta(seconds=backoff_delay(job.attempts))
+                    outcome = 'retry'
+                logger.warning(f"مزامنة Drive للملف {job.file_name}: {error[:200]}")
+            else:
+                job.status = STATUS_DONE
+                job.locked_until = None
+                job.last_error = None
+                job.upload_uri = None
+                job.bytes_uploaded = job.file_size
+                job.completed_at = datetime.utcnow()
+                job.drive_file_id = file_info.get('id')
+                job.drive_view_url = file_info.get('webViewLink')
+                job.drive_download_url = file_info.get('webContentLink')
+                _on_finished(job)
+                outcome = 'done'
+            db.session.commit()
+
+            if outcome == 'done':
+                # بعد الحفظ: الذاكرة تكتب في اتصال مستقل لا ينتظر قفل معاملة العامل
+                drive_cache.put_files(client.namespace, [file_info], parent_id=job.drive_folder_id)
+            if outcome == 'done' and job.delete_after:
+                try:
+                    os.remove(os.path.join(PROJECT_ROOT, job.local_path))
+                except OSError:
+                    pass
+            return outcome
+        except Exception as e:
+            logger.error(f"خطأ في تسجيل نتيجة مزامنة Drive للملف {job_id}: {e}")
+            db.session.rollback()
+            return 'retry'
+        finally:
+            db.session.remove()
+
+
+def sync_due(limit=BATCH_SIZE, client=None):
+    """
+    رفع دفعة من الملفات المستحقة
+
+    :param client: عميل Drive (افتراضياً configured_client، أو FakeDriveClient للاختبار)
+    :return: قاموس بعدد المرفوع والمؤجل والفاشل، أو None إذا كان عامل آخر يعمل في هذه العملية
+    """
+    if not _sync_lock.acquire(blocking=False):
+        return None
+    try:
+        stats = {'done': 0, 'retry': 0, 'failed': 0}
+        client = client or configured_client()
+        if client is None:
+            logger.debug('Google Drive غير مكوّن؛ الملفات تبقى في قائمة المزامنة')
+            return stats
+
+        job_ids = claim_batch(limit)
+        if not job_ids:
+            return stats
+
+        app = current_app._get_current_object()
+        workers = max(1, min(WORKERS, len(job_ids)))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='drive-upload') as pool:
+            outcomes = list(pool.map(lambda job_id: _process_job(app, job_id, client), job_ids))
+
+        for outcome in outcomes:
+            if outcome in stats:
+                stats[outcome] += 1
+        logger.info(f"مزامنة Drive: {stats}")
+        return stats
+    finally:
+        _sync_lock.release()
+
+
+def _run_sync(app):
+    _scheduled.clear()
+    with app.app_context():
+        try:
+            while True:
+                stats = sync_due()
+                if not stats or sum(stats.values()) < BATCH_SIZE:
+                    break
+        except Exception as e:
+            logger.error(f"خطأ في عامل مزامنة Drive: {e}")
+            db.session.rollback()
+        finally:
+            db.session.remove()
+
+
+def schedule_sync(app=None):
+    """تشغيل العامل في الخلفية فوراً (الطلبات المتتالية تُدمج في تشغيل واحد)"""
+    if _scheduled.is_set():
+        return
+    _scheduled.set()
+    _executor.submit(_run_sync, app or current_app._get_current_object())
+
+
+@event.listens_for(Session, 'after_commit')
+def _on_commit(session):
+    if session.info.pop(_SESSION_KEY, None):
+        try:
+            schedule_sync()
+        except RuntimeError:
+            # خارج سياق التطبيق: المهمة الدورية ستلتقط الملفات
+            pass
+
+
+@event.listens_for(Session, 'after_rollback')
+def _on_rollback(session):
+    session.info.pop(_SESSION_KEY, None)
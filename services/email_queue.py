@@ -0,0 +1,608 @@
+"""
+قائمة الإيميلات الصادرة في قاعدة البيانات مع عامل إرسال
+
+كل إيميل سجل في جدول email_queue بحالة وعدد محاولات وموعد المحاولة التالية
+(مفهرسة)، والمرفقات تُحفظ مرة واحدة في مخزن الملفات (BlobStore) ويُخزن مرجعها فقط.
+الطلب يضيف الإيميل للقائمة ويعود فوراً، والإرسال يتم في الخلفية:
+
+- عامل يحجز دفعة من الإيميلات المستحقة (FOR UPDATE SKIP LOCKED في PostgreSQL)
+  ويوزعها على عدة خيوط، كل خيط يفتح اتصالاً واحداً للدفعة كلها
+- SendGrid عبر جلسة HTTP مشتركة (keep-alive) بدلاً من اتصال جديد لكل إيميل
+- الفشل المؤقت يعاد بتأخير أسي (1، 2، 4 دقائق... حتى 6 ساعات)، والفشل الدائم
+  (عنوان مرفوض، طلب غير صالح) يتوقف فوراً
+
+الناقل يُحدد بالمتغير EMAIL_TRANSPORT (smtp أو sendgrid)، وافتراضياً SMTP إذا
+ضُبط EMAIL_SMTP_HOST وإلا SendGrid إذا توفر المفتاح. بدون ناقل تبقى الإيميلات
+في القائمة. للتجربة محلياً يكفي خادم SMTP وهمي:
+    python -m aiosmtpd -n -l localhost:1025
+    EMAIL_SMTP_HOST=localhost EMAIL_SMTP_PORT=1025 flask email-queue-send
+"""
+import base64
+import json
+import logging
+import os
+import random
+import smtplib
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from email.message import EmailMessage
+from email.utils import formataddr, make_msgid
+
+import requests
+from flask import current_app
+from requests.adapters import HTTPAdapter
+from sqlalchemy import and_, event, func, or_
+from sqlalchemy.orm import Session, defer
+
+from app import db
+from models import QueuedEmail, QueuedEmailAttachment
+from services.blob_store import BlobStore
+
+logger = logging.getLogger(__name__)
+
+STATUS_QUEUED = 'queued'
+STATUS_SENDING = 'sending'
+STATUS_SENT = 'sent'
+STATUS_FAILED = 'failed'
+
+STATUS_LABELS = {
+    STATUS_QUEUED: 'في الانتظار',
+    STATUS_SENDING: 'جاري الإرسال',
+    STATUS_SENT: 'تم الإرسال',
+    STATUS_FAILED: 'فشل',
+}
+
+DEFAULT_FROM_EMAIL = 'noreply@eissa.site'
+DEFAULT_FROM_NAME = 'نظام نُظم'
+
+BATCH_SIZE = int(os.environ.get('EMAIL_QUEUE_BATCH_SIZE', 50))
+WORKERS = int(os.environ.get('EMAIL_QUEUE_WORKERS', 4))
+
+# إيميلات أُضيفت ضمن معاملة المستدعي (commit=False): الإرسال يبدأ بعد حفظها
+_SESSION_KEY = 'email_queue_pending'
+
+# الإيميل المحجوز لعامل توقف دون تسجيل النتيجة يعود للقائمة بعد هذه المدة
+LOCK_TIMEOUT = timedelta(minutes=5)
+
+BACKOFF_BASE = 60
+BACKOFF_MAX = 6 * 3600
+
+
+class PermanentDeliveryError(Exception):
+    """فشل لن تصلحه إعادة المحاولة (عنوان مرفوض، رسالة غير صالحة)"""
+
+
+def backoff_delay(attempts):
+    """التأخير قبل المحاولة التالية بالثواني: أسي مع تذبذب عشوائي ±20%"""
+    delay = min(BACKOFF_BASE * (2 ** max(attempts - 1, 0)), BACKOFF_MAX)
+    return delay * random.uniform(0.8, 1.2)
+
+
+# ---------------------------------------------------------------------------
+# الناقلات
+# ---------------------------------------------------------------------------
+
+def build_mime_message(email):
+    """بناء رسالة MIME من بيانات الإيميل (للإرسال عبر SMTP أو ملف .eml)"""
+    message = EmailMessage()
+    message['Subject'] = email['subject']
+    message['From'] = formataddr((email['from_name'] or '', email['from_email']))
+    message['To'] = formataddr((email['to_name'] or '', email['to_email']))
+    message['Message-ID'] = make_msgid(idstring=email['message_id'])
+    message.set_content(email['text_content'] or 'يرجى عرض هذه الرسالة في برنامج يدعم HTML')
+    if email['html_content']:
+        message.add_alternative(email['html_content'], subtype='html')
+    for filename, content_type, path in email['attachments']:
+        maintype, _, subtype = (content_type or 'application/octet-stream').partition('/')
+        with open(path, 'rb') as f:
+            message.add_attachment(f.read(), maintype=maintype, subtype=subtype or 'octet-stream',
+                                   filename=filename)
+    return message
+
+
+class SMTPTransport:
+    """إرسال عبر خادم SMTP باتصال واحد مفتوح لكل دفعة"""
+
+    name = 'smtp'
+
+    def __init__(self, host, port=25, username=None, password=None, use_tls=False, use_ssl=False, timeout=30):
+        self.options = dict(host=host, port=port, username=username, password=password,
+                            use_tls=use_tls, use_ssl=use_ssl, timeout=timeout)
+        self.connection = None
+
+    def open(self):
+        options = self.options
+        smtp_class = smtplib.SMTP_SSL if options['use_ssl'] else smtplib.SMTP
+        self.connection = smtp_class(options['host'], options['port'], timeout=options['timeout'])
+        if options['use_tls'] and not options['use_ssl']:
+            self.connection.starttls()
+        if options['username']:
+            self.connection.login(options['username'], options['password'] or '')
+
+    def close(self):
+        if self.connection is not None:
+            try:
+                self.connection.quit()
+            except smtplib.SMTPException:
+                pass
+            except OSError:
+                pass
+            self.connection = None
+
+    def send(self, email):
+        message = build_mime_message(email)
+        for attempt in range(2):
+            if self.connection is None:
+                self.open()
+            try:
+                self.connection.send_message(message)
+                return message['Message-ID']
+            except smtplib.SMTPServerDisconnected:
+                # الخادم أغلق الاتصال الخامل؛ إعادة الفتح مرة واحدة
+                self.connection = None
+                if attempt:
+                    raise
+            except smtplib.SMTPRecipientsRefused as e:
+                raise PermanentDeliveryError(f'العنوان مرفوض: {e.recipients}')
+            except smtplib.SMTPResponseException as e:
+                if e.smtp_code >= 500:
+                    raise PermanentDeliveryError(f'{e.smtp_code} {e.smtp_error!r}')
+                raise
+
+
+class SendGridTransport:
+    """إرسال عبر SendGrid v3 بجلسة HTTP مشتركة بين كل الإرسالات"""
+
+    name = 'sendgrid'
+    API_URL = 'https://api.sendgrid.com/v3/mail/send'
+
+    _session = None
+    _session_lock = threading.Lock()
+
+    def __init__(self, api_key, timeout=30):
+        self.options = dict(api_key=api_key, timeout=timeout)
+
+    @classmethod
+    def session(cls):
+        with cls._session_lock:
+            if cls._session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(WORKERS, 1))
+                session.mount('https://', adapter)
+                cls._session = session
+            return cls._session
+
+    def open(self):
+        pass
+
+    def close(self):
+        pass
+
+    @staticmethod
+    def build_payload(email):
+        recipient = {'email': email['to_email']}
+        if email['to_name']:
+            recipient['name'] = email['to_name']
+        content = []
+        if email['text_content']:
+            content.append({'type': 'text/plain', 'value': email['text_content']})
+        content.append({'type': 'text/html', 'value': email['html_content'] or email['text_content'] or ' '})
+        payload = {
+            'personalizations': [{'to': [recipient], 'custom_args': {'queue_id': email['message_id']}}],
+            'from': {'email': email['from_email'], 'name': email['from_name'] or DEFAULT_FROM_NAME},
+            'subject': email['subject'],
+            'content': content,
+        }
+        attachments = []
+        for filename, content_type, path in email['attachments']:
+            with open(path, 'rb') as f:
+                attachments.append({
+                    'content': base64.b64encode(f.read()).decode(),
+                    'filename': filename,
+                    'type': content_type or 'application/octet-stream',
+                    'disposition': 'attachment',
+                })
+        if attachments:
+            payload['attachments'] = attachments
+        return payload
+
+    def send(self, email):
+        response = self.session().post(
+            self.API_URL,
+            json=self.build_payload(email),
+            headers={'Authorization': f"Bearer {self.options['api_key']}"},
+            timeout=self.options['timeout'],
+        )
+        if response.status_code in (200, 202):
+            return response.headers.get('X-Message-Id')
+        error = f'SendGrid {response.status_code}: {response.text[:500]}'
+        if response.status_code == 429 or response.status_code >= 500:
+            raise RuntimeError(error)
+        raise PermanentDeliveryError(error)
+
+
+def configured_transport():
+    """الناقل المضبوط في البيئة، أو None إذا لم يُضبط أي ناقل"""
+    choice = os.environ.get('EMAIL_TRANSPORT', '').lower()
+    smtp_host = os.environ.get('EMAIL_SMTP_HOST')
+
+    if choice == 'smtp' or (not choice and smtp_host):
+        return SMTPTransport(
+            host=smtp_host or 'localhost',
+            port=int(os.environ.get('EMAIL_SMTP_PORT', 25)),
+            username=os.environ.get('EMAIL_SMTP_USERNAME'),
+            password=os.environ.get('EMAIL_SMTP_PASSWORD'),
+            use_tls=os.environ.get('EMAIL_SMTP_STARTTLS', '').lower() in ('1', 'true', 'yes'),
+            use_ssl=os.environ.get('EMAIL_SMTP_SSL', '').lower() in ('1', 'true', 'yes'),
+        )
+
+    sendgrid_configured = os.environ.get('SENDGRID_API_KEY') or os.environ.get('REPLIT_CONNECTORS_HOSTNAME')
+    if choice in ('', 'sendgrid') and sendgrid_configured:
+        from services.email_service import EmailService
+        api_key = EmailService().sendgrid_key
+        if api_key:
+            return SendGridTransport(api_key)
+    return None
+
+
+# ---------------------------------------------------------------------------
+# العامل
+# ---------------------------------------------------------------------------
+
+_delivery_lock = threading.Lock()
+_scheduled = threading.Event()
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='email-queue')
+
+
+def _snapshot(email):
+    """نسخة مستقلة عن الجلسة لتمريرها لخيوط الإرسال"""
+    return {
+        'id': email.id,
+        'message_id': email.message_id,
+        'to_email': email.to_email,
+        'to_name': email.to_name,
+        'from_email': email.from_email,
+        'from_name': email.from_name,
+        'subject': email.subject,
+        'html_content': email.html_content,
+        'text_content': email.text_content,
+        'attachments': [(a.filename, a.content_type, BlobStore.local_path(a.file_path))
+                        for a in email.attachments],
+    }
+
+
+def claim_batch(limit=BATCH_SIZE):
+    """حجز دفعة من الإيميلات المستحقة لهذا العامل"""
+    now = datetime.utcnow()
+    query = QueuedEmail.query.filter(or_(
+        and_(QueuedEmail.status == STATUS_QUEUED,
+             or_(QueuedEmail.next_attempt_at.is_(None), QueuedEmail.next_attempt_at <= now)),
+        and_(QueuedEmail.status == STATUS_SENDING, QueuedEmail.locked_until < now)
+    )).order_by(QueuedEmail.next_attempt_at.asc()).limit(limit)
+    if db.engine.dialect.name == 'postgresql':
+        # عدة عمليات تسحب من نفس القائمة دون أن تحجز نفس الإيميل
+        query = query.with_for_update(skip_locked=True)
+
+    emails = query.all()
+    for email in emails:
+        email.status = STATUS_SENDING
+        email.locked_until = now + LOCK_TIMEOUT
+        email.attempts = (email.attempts or 0) + 1
+    batch = [_snapshot(email) for email in emails]
+    db.session.commit()
+    return batch
+
+
+def _send_chunk(transport, chunk):
+    """إرسال جزء من الدفعة عبر اتصال واحد"""
+    results = []
+    try:
+        transport.open()
+    except Exception as e:
+        return [(email['id'], STATUS_QUEUED, f'تعذر الاتصال بالناقل: {e}', None) for email in chunk]
+    try:
+        for email in chunk:
+            try:
+                provider_id = transport.send(email)
+                results.append((email['id'], STATUS_SENT, None, provider_id))
+            except PermanentDeliveryError as e:
+                results.append((email['id'], STATUS_FAILED, str(e), None))
+            except Exception as e:
+                results.append((email['id'], STATUS_QUEUED, str(e), None))
+    finally:
+        transport.close()
+    return results
+
+
+def _record_results(results, transport_name):
+    """تسجيل نتائج الدفعة بعملية حفظ واحدة، مع جدولة إعادة المحاولة"""
+    stats = {'sent': 0, 'retry': 0, 'failed': 0}
+    now = datetime.utcnow()
+    for email_id, status, error, provider_id in results:
+        email = db.session.get(QueuedEmail, email_id)
+        if email is None:
+            continue
+        email.locked_until = None
+        email.transport = transport_name
+        email.last_error = error
+        if status == STATUS_SENT:
+            email.status = STATUS_SENT
+            email.sent_at = now
+            stats['sent'] += 1
+        elif status == STATUS_FAILED or email.attempts >= email.max_attempts:
+            email.status = STATUS_FAILED
+            stats['failed'] += 1
+        else:
+            email.status = STATUS_QUEUED
+            email.next_attempt_at = now + timedelta(seconds=backoff_delay(email.attempts))
+            stats['retry'] += 1
+    db.session.commit()
+    return stats
+
+
+def deliver_due(limit=BATCH_SIZE, transport=None):
+    """
+    إرسال دفعة من الإيميلات المستحقة
+
+    :param transport: ناقل محدد (افتراضياً configured_transport)
+    :return: قاموس بعدد المرسل والمؤجل والفاشل، أو None إذا كان عامل آخر يعمل في هذه العملية
+    """
+    if not _delivery_lock.acquire(blocking=False):
+        return None
+    try:
+        stats = {'sent': 0, 'retry': 0, 'failed': 0}
+        transport = transport or configured_transport()
+        if transport is None:
+            logger.debug('لا يوجد ناقل إيميل مضبوط؛ الإيميلات تبقى في القائمة')
+            return stats
+
+        batch = claim_batch(limit)
+        if not batch:
+            return stats
+
+        # كل خيط بنسخة مستقلة من الناقل (اتصال SMTP خاص به)
+        workers = max(1, min(WORKERS, len(batch)))
+        chunks = [batch[i::workers] for i in range(workers)]
+        transports = [type(transport)(**transport.options) for _ in chunks]
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            chunk_results = list(pool.map(_send_chunk, transports, chunks))
+
+        results = [result for chunk in chunk_results for result in chunk]
+        stats = _record_results(results, transport.name)
+        logger.info(f"قائمة الإيميلات: {stats}")
+        return stats
+    finally:
+        _delivery_lock.release()
+
+
+def _run_delivery(app):
+    _scheduled.clear()
+    with app.app_context():
+        try:
+            while True:
+                stats = deliver_due()
+                # دفعة كاملة تعني غالباً وجود المزيد
+                if not stats or sum(stats.values()) < BATCH_SIZE:
+                    break
+        except Exception as e:
+            logger.error(f"خطأ في عامل قائمة الإيميلات: {e}")
+            db.session.rollback()
+        finally:
+            db.session.remove()
+
+
+def schedule_delivery(app=None):
+    """تشغيل العامل في الخلفية فوراً (الطلبات المتتالية تُدمج في تشغيل واحد)"""
+    if _scheduled.is_set():
+        return
+    _scheduled.set()
+    _executor.submit(_run_delivery, app or current_app._get_current_object())
+
+
+@event.listens_for(Session, 'after_commit')
+def _on_commit(session):
+    if session.info.pop(_SESSION_KEY, False):
+        try:
+            schedule_delivery()
+        except Exception as e:
+            # خارج سياق التطبيق: المهمة الدورية ترسلها لاحقاً
+            logger.warning(f"تعذر تشغيل عامل الإيميلات بعد الحفظ: {e}")
+
+
+@event.listens_for(Session, 'after_rollback')
+def _on_rollback(session):
+    session.info.pop(_SESSION_KEY, None)
+
+
+# ---------------------------------------------------------------------------
+# واجهة القائمة
+# ---------------------------------------------------------------------------
+
+def _attachment_bytes(attachment):
+    content = attachment.get('content')
+    if isinstance(content, bytes):
+        return content
+    if content is None:
+        return b''
+    try:
+        return base64.b64decode(content, validate=True)
+    except (ValueError, TypeError):
+        return str(content).encode('utf-8')
+
+
+class EmailQueue:
+    """إضافة الإيميلات للقائمة وإدارتها"""
+
+    @staticmethod
+    def enqueue(to_email, subject, html_content=None, from_email=None, from_name=None,
+                to_name=None, text_content=None, attachments=None, commit=True):
+        """
+        إضافة إيميل للقائمة وتشغيل الإرسال في الخلفية
+
+        :param attachments: قائمة {'filename', 'content' (bytes أو base64), 'content_type'}
+        :param commit: False لإضافة الإيميل ضمن معاملة المستدعي دون حفظها؛ يُرسل بعد أن يحفظها
+                       المستدعي ويُلغى إذا تراجع عنها
+        :return: سجل QueuedEmail
+        """
+        email = QueuedEmail(
+            message_id=f"email_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:8]}",
+            to_email=to_email,
+            to_name=to_name,
+            from_email=from_email or DEFAULT_FROM_EMAIL,
+            from_name=from_name or DEFAULT_FROM_NAME,
+            subject=subject or '',
+            html_content=html_content,
+            text_content=text_content,
+            status=STATUS_QUEUED,
+            next_attempt_at=datetime.utcnow(),
+        )
+        for attachment in attachments or []:
+            filename = attachment.get('filename')
+            if not filename:
+                continue
+            content = _attachment_bytes(attachment)
+            path, _ = BlobStore.save_bytes(content, filename.rsplit('.', 1)[-1] if '.' in filename else 'bin')
+            if not path:
+                continue
+            email.attachments.append(QueuedEmailAttachment(
+                filename=filename,
+                content_type=attachment.get('content_type') or 'application/octet-stream',
+                size=len(content),
+                file_path=path,
+            ))
+        db.session.add(email)
+
+        if commit:
+            db.session.commit()
+            schedule_delivery()
+        else:
+            db.session.flush()
+            db.session.info[_SESSION_KEY] = True
+        return email
+
+    @staticmethod
+    def list_emails(page=1, per_page=25, status=None):
+        """صفحة من القائمة باستعلام مفهرس دون تحميل محتوى الرسائل"""
+        query = QueuedEmail.query.options(defer(QueuedEmail.html_content), defer(QueuedEmail.text_content))
+        if status:
+            query = query.filter(QueuedEmail.status == status)
+        return query.order_by(QueuedEmail.created_at.desc()).paginate(
+            page=page, per_page=per_page, error_out=False
+        )
+
+    @staticmethod
+    def status_counts():
+        rows = db.session.query(QueuedEmail.status, func.count(QueuedEmail.id)).group_by(QueuedEmail.status).all()
+        return {status: count for status, count in rows}
+
+    @staticmethod
+    def get(message_id):
+        return QueuedEmail.query.filter_by(message_id=message_id).first()
+
+    @staticmethod
+    def to_dict(email):
+        return {
+            'id': email.message_id,
+            'to_email': email.to_email,
+            'to_name': email.to_name,
+            'from_email': email.from_email,
+            'from_name': email.from_name,
+            'subject': email.subject,
+            'html_content': email.html_content,
+            'created_at': email.created_at.isoformat() if email.created_at else None,
+            'sent_at': email.sent_at.isoformat() if email.sent_at else None,
+            'status': email.status,
+            'attempts': email.attempts,
+            'last_error': email.last_error,
+            'attachments': [{
+                'filename': a.filename,
+                'content_type': a.content_type,
+                'file_path': a.file_path,
+                'size': a.size or 0,
+            } for a in email.attachments],
+        }
+
+    @staticmethod
+    def retry(email):
+        """إعادة إيميل فاشل للقائمة"""
+        email.status = STATUS_QUEUED
+        email.attempts = 0
+        email.next_attempt_at = datetime.utcnow()
+        email.locked_until = None
+        db.session.commit()
+        schedule_delivery()
+
+    @staticmethod
+    def delete(email):
+        """حذف إيميل وتحرير مراجع مرفقاته في مخزن الملفات"""
+        for attachment in email.attachments:
+            BlobStore.release(attachment.file_path)
+        db.session.delete(email)
+        db.session.commit()
+
+    @staticmethod
+    def import_legacy_directory(directory='emails_queue', status=STATUS_FAILED):
+        """
+        استيراد الإيميلات المحفوظة كملفات JSON في النظام القديم
+
+        تُستورد افتراضياً بحالة "فشل" حتى لا تُرسل رسائل قديمة تلقائياً؛
+        يمكن إعادة إرسال أي منها من صفحة القائمة.
+        :return: (عدد المستورد، عدد المتجاوز)
+        """
+        imported = skipped = 0
+        if not os.path.isdir(directory):
+            return imported, skipped
+
+        for filename in sorted(os.listdir(directory)):
+            if not filename.endswith('.json'):
+                continue
+            path = os.path.join(directory, filename)
+            try:
+                with open(path, encoding='utf-8') as f:
+                    data = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.warning(f"تعذر قراءة {path}: {e}")
+                skipped += 1
+                continue
+
+            message_id = data.get('id') or filename[:-5]
+            if QueuedEmail.query.filter_by(message_id=message_id).first():
+                skipped += 1
+                continue
+
+            try:
+                created_at = datetime.fromisoformat(data['created_at'])
+            except (KeyError, TypeError, ValueError):
+                created_at = datetime.utcnow()
+
+            email = QueuedEmail(
+                message_id=message_id,
+                to_email=data.get('to_email') or '',
+                from_email=data.get('from_email') or DEFAULT_FROM_EMAIL,
+                from_name=data.get('from_name') or DEFAULT_FROM_NAME,
+                subject=data.get('subject') or '',
+                html_content=data.get('html_content'),
+                status=status,
+                next_attempt_at=datetime.utcnow(),
+                last_error='مستورد من قائمة الملفات القديمة' if status == STATUS_FAILED else None,
+                created_at=created_at,
+            )
+            for attachment in data.get('attachments') or []:
+                attachment_path = attachment.get('file_path')
+                if not attachment_path or not os.path.exists(attachment_path):
+                    continue
+                with open(attachment_path, 'rb') as f:
+                    blob_path, _ = BlobStore.save(f, attachment.get('filename') or os.path.basename(attachment_path))
+                if blob_path:
+                    email.attachments.append(QueuedEmailAttachment(
+                        filename=attachment.get('filename') or os.path.basename(attachment_path),
+                        content_type=attachment.get('content_type') or 'application/octet-stream',
+                        size=os.path.getsize(attachment_path),
+                        file_path=blob_path,
+                    ))
+            db.session.add(email)
+            db.session.commit()
+            imported += 1
+        return imported, skipped
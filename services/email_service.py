@@ -62,6 +62,36 @@ class EmailService:
         else:
             current_app.logger.error("SENDGRID_API_KEY غير متوفر")
     
+    def _enqueue(self, message):
+        """
+        إضافة رسالة SendGrid إلى قائمة الإرسال بدلاً من إرسالها داخل الطلب
+        (العامل في services/email_queue.py يرسلها عبر جلسة HTTP مشتركة مع إعادة المحاولة)
+
+        الإيميل يُضاف لمعاملة المستدعي دون حفظها؛ يُرسل بعد أن يحفظ المستدعي معاملته.
+        """
+        from services.email_queue import EmailQueue
+        
+        payload = message.get()
+        personalization = payload['personalizations'][0]
+        recipient = personalization['to'][0]
+        contents = {item['type']: item['value'] for item in payload.get('content', [])}
+        
+        return EmailQueue.enqueue(
+            to_email=recipient['email'],
+            to_name=recipient.get('name'),
+            from_email=payload['from']['email'],
+            from_name=payload['from'].get('name'),
+            subject=payload.get('subject') or personalization.get('subject'),
+            html_content=contents.get('text/html'),
+            text_content=contents.get('text/plain'),
+            attachments=[{
+                'filename': attachment['filename'],
+                'content': base64.b64decode(attachment['content']),
+                'content_type': attachment.get('type')
+            } for attachment in payload.get('attachments', [])],
+            commit=False
+        )
+    
     def send_vehicle_operation_files(self, to_email, to_name, operation, vehicle_plate, driver_name, excel_file_path=None, pdf_file_path=None, sender_email=None):
         """
         إرسال ملفات العملية مع تفاصيل السيارة عبر الإيميل
@@ -356,14 +386,15 @@ class EmailService:
                 message.attachment = attachments
             
             # إرسال الرسالة
-            response = self.sg.send(message)
+            queued = self._enqueue(message)
             
-            current_app.logger.info(f"Email sent successfully to {to_email} for operation {operation.id}")
+            current_app.logger.info(f"Email queued for {to_email} for operation {operation.id}")
             
             return {
                 "success": True, 
-                "message": "تم إرسال الإيميل بنجاح",
-                "status_code": response.status_code
+                "message": "تمت إضافة الإيميل إلى قائمة الإرسال وسيُرسل خلال لحظات",
+                "status_code": 202,
+                "message_id": queued.message_id
             }
             
         except Exception as e:
@@ -544,14 +575,15 @@ class EmailService:
                 message.attachment = attachments
             
             # إرسال الرسالة
-            response = self.sg.send(message)
+            queued = self._enqueue(message)
             
-            current_app.logger.info(f"Email sent successfully to {to_email} for handover operation")
+            current_app.logger.info(f"Email queued for {to_email} for handover operation")
             
             return {
                 "success": True, 
-                "message": "تم إرسال الإيميل بنجاح",
-                "status_code": response.status_code
+                "message": "تمت إضافة الإيميل إلى قائمة الإرسال وسيُرسل خلال لحظات",
+                "status_code": 202,
+                "message_id": queued.message_id
             }
             
         except Exception as e:
@@ -578,12 +610,13 @@ class EmailService:
                 html_content=content
             )
             
-            response = self.sg.send(message)
+            queued = self._enqueue(message)
             
             return {
                 "success": True,
-                "message": "تم إرسال الإيميل بنجاح",
-                "status_code": response.status_code
+                "message": "تمت إضافة الإيميل إلى قائمة الإرسال وسيُرسل خلال لحظات",
+                "status_code": 202,
+                "message_id": queued.message_id
             }
             
         except Exception as e:
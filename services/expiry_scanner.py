@@ -0,0 +1,380 @@
+"""
+ماسح انتهاء الصلاحيات: تنبيهات مجمعة بدون تكرار
+
+كان مسار test-notifications في routes/documents.py يمر على الوثائق القريبة من الانتهاء
+ولكل وثيقة على كل المستخدمين، فينشئ الإشعارات واحداً واحداً، وكل تشغيل يكرر نفس
+الإشعارات. الآن مهمة مجدولة (expiry-scan) تمسح كل المصادر:
+
+- وثائق الموظفين، واستمارة المركبة وفحصها الدوري وتفويضها، وعقود إيجار السكن
+- كل مصدر باستعلام نطاق واحد على عمود تاريخ الانتهاء المفهرس: من EXPIRED_LOOKBACK_DAYS
+  يوماً مضت حتى أكبر عتبة قادمة
+- لكل عنصر عتبة واحدة (THRESHOLDS: 30، 14، 7، 0 = منتهية): أصغر عتبة لا تقل عن
+  الأيام المتبقية
+- التنبيه مفتاحه (الكيان، المعرف، تاريخ الانتهاء، العتبة) في جدول expiry_alerts بقيد
+  فريد، ويُدرج دفعة واحدة مع تجاهل الموجود؛ الإشعارات تُنشأ للتنبيهات الجديدة فقط، فإعادة
+  التشغيل لا تكرر شيئاً، وتجديد الوثيقة (تاريخ انتهاء جديد) يبدأ سلسلة تنبيهات جديدة
+- المستلمون: المديرون ومستخدمو قسم العنصر (القسم المخصص أو الأقسام المتاحة)، تُحسب
+  بجدول واحد لكل الأقسام في بداية المسح ثم لكل مجموعة أقسام مرة واحدة
+- الإشعارات تُدرج بعبارة INSERT واحدة لكل دفعة (notification_hub.insert_many)
+- آخر مسح لكل مصدر يُسجل في expiry_scan_watermarks (النطاق، المطابق، الجديد، المدة)
+
+التشغيل اليدوي: flask expiry-scan [--dry-run]
+"""
+import logging
+import os
+import time
+from collections import OrderedDict, defaultdict, namedtuple
+from datetime import date, datetime, timedelta
+
+from flask import current_app, has_request_context, url_for
+from sqlalchemy import select
+
+from app import db
+
+logger = logging.getLogger(__name__)
+
+# عتبات التنبيه بالأيام، تنازلياً (0 = منتهية)
+THRESHOLDS = tuple(sorted({max(int(days), 0) for days in
+                           os.environ.get('EXPIRY_ALERT_DAYS', '30,14,7,0').split(',') if days.strip()} | {0},
+                          reverse=True))
+# العناصر المنتهية منذ أكثر من ذلك لا تُنبّه (تُعتبر مهملة لا جديدة)
+EXPIRED_LOOKBACK_DAYS = int(os.environ.get('EXPIRY_EXPIRED_LOOKBACK_DAYS', 30))
+
+BATCH_SIZE = 500
+
+NOTIFICATION_TYPE = 'document_expiry'
+
+# عنصر قريب من الانتهاء من أحد المصادر
+Item = namedtuple('Item', 'entity_id expiry_date label subject department_ids')
+
+
+def threshold_for(days_left):
+    """عتبة التنبيه لعنصر يتبقى عليه days_left يوماً (None إذا كان أبعد من أكبر عتبة)"""
+    if days_left > THRESHOLDS[0]:
+        return None
+    return min(threshold for threshold in THRESHOLDS if threshold >= max(days_left, 0))
+
+
+def _message(label, subject, days_left):
+    """عنوان الإشعار ونصه وأولويته (بنفس صياغة إشعارات الوثائق)"""
+    if days_left < 0:
+        return (f'{label} منتهية - {subject}',
+                f'انتهت صلاحية {label} ({subject}) منذ {abs(days_left)} يوم', 'critical')
+    if days_left == 0:
+        return (f'{label} تنتهي اليوم - {subject}', f'تنتهي صلاحية {label} ({subject}) اليوم', 'critical')
+    if days_left <= 7:
+        return ('تنبيه عاجل: وثيقة تنتهي قريباً',
+                f'{label} ({subject}) تنتهي خلال {days_left} أيام', 'critical')
+    if days_left <= 30:
+        return ('تذكير: وثيقة تنتهي خلال شهر',
+                f'{label} ({subject}) تنتهي خلال {days_left} يوماً', 'high')
+    return ('تذكير: وثيقة قريبة من الانتهاء',
+            f'{label} ({subject}) تنتهي خلال {days_left} يوماً', 'normal')
+
+
+def _url(endpoint, **values):
+    """رابط الإشعار (المجدول يعمل خارج أي طلب)"""
+    try:
+        if has_request_context():
+            return url_for(endpoint, **values)
+        with current_app.test_request_context():
+            return url_for(endpoint, **values)
+    except Exception:
+        return None
+
+
+# ---------------------------------------------------------------------------
+# المصادر
+# ---------------------------------------------------------------------------
+
+def _chunks(rows, size=BATCH_SIZE):
+    for start in range(0, len(rows), size):
+        yield rows[start:start + size]
+
+
+def _documents(start, end):
+    from models import Document, Employee, employee_departments
+    from services.search_index import DOCUMENT_TYPE_LABELS
+
+    rows = db.session.execute(
+        select(Document.id, Document.expiry_date, Document.document_type, Employee.id, Employee.name)
+        .join(Employee, Document.employee_id == Employee.id)
+        .where(Document.expiry_date.between(start, end))
+        .order_by(Document.expiry_date, Document.id)
+    ).all()
+    for chunk in _chunks(rows):
+        departments = defaultdict(list)
+        for employee_id, department_id in db.session.execute(
+                select(employee_departments.c.employee_id, employee_departments.c.department_id)
+                .where(employee_departments.c.employee_id.in_({row[3] for row in chunk}))):
+            departments[employee_id].append(department_id)
+        yield [Item(doc_id, expiry, DOCUMENT_TYPE_LABELS.get(doc_type, doc_type or 'وثيقة'),
+                    name or 'غير محدد', tuple(departments[employee_id]))
+               for doc_id, expiry, doc_type, employee_id, name in chunk]
+
+
+def _vehicle_source(column, label):
+    def rows(start, end):
+        from models import Vehicle
+
+        expiry = getattr(Vehicle, column)
+        result = db.session.execute(
+            select(Vehicle.id, expiry, Vehicle.plate_number, Vehicle.department_id)
+            .where(expiry.between(start, end))
+            .order_by(expiry, Vehicle.id)
+        ).all()
+        for chunk in _chunks(result):
+            yield [Item(vehicle_id, expiry_date, label, f'المركبة {plate}',
+                        (department_id,) if department_id else ())
+                   for vehicle_id, expiry_date, plate, department_id in chunk]
+    return rows
+
+
+def _property_contracts(start, end):
+    from models import RentalProperty
+
+    rows = db.session.execute(
+        select(RentalProperty.id, RentalProperty.contract_end_date, RentalProperty.city,
+               RentalProperty.contract_number)
+        .where(RentalProperty.contract_end_date.between(start, end),
+               RentalProperty.is_active.isnot(False))
+        .order_by(RentalProperty.contract_end_date, RentalProperty.id)
+    ).all()
+    for chunk in _chunks(rows):
+        yield [Item(property_id, end_date, 'عقد إيجار السكن',
+                    f'{city} {number}' if number else city, ())
+               for property_id, end_date, city, number in chunk]
+
+
+# المصدر -> (دالة الصفوف، نوع الكيان في الإشعار، رابط الإشعار)
+SOURCES = OrderedDict([
+    ('document', (_documents, 'document', lambda item: _url('documents.dashboard'))),
+    ('vehicle_registration', (_vehicle_source('registration_expiry_date', 'استمارة المركبة'), 'vehicle',
+                              lambda item: _url('vehicles.view', id=item.entity_id))),
+    ('vehicle_inspection', (_vehicle_source('inspection_expiry_date', 'الفحص الدوري'), 'vehicle',
+                            lambda item: _url('vehicles.view', id=item.entity_id))),
+    ('vehicle_authorization', (_vehicle_source('authorization_expiry_date', 'التفويض'), 'vehicle',
+                               lambda item: _url('vehicles.view', id=item.entity_id))),
+    ('property_contract', (_property_contracts, 'property',
+                           lambda item: _url('properties.view', property_id=item.entity_id))),
+])
+
+
+# ---------------------------------------------------------------------------
+# المستلمون
+# ---------------------------------------------------------------------------
+
+class Recipients:
+    """مستلمو التنبيهات: المديرون ومستخدمو كل قسم، محسوبة مرة واحدة لكل مسح"""
+
+    def __init__(self):
+        from models import User, UserRole, user_accessible_departments
+
+        self.admins = set()
+        self.by_department = defaultdict(set)
+        active = User.is_active.isnot(False)
+        for user_id, role, department_id in db.session.execute(
+                select(User.id, User.role, User.assigned_department_id).where(active)):
+            if role == UserRole.ADMIN:
+                self.admins.add(user_id)
+            elif department_id is not None:
+                self.by_department[department_id].add(user_id)
+        for user_id, department_id in db.session.execute(
+                select(user_accessible_departments.c.user_id, user_accessible_departments.c.department_id)
+                .join(User, User.id == user_accessible_departments.c.user_id).where(active)):
+            self.by_department[department_id].add(user_id)
+        self._memo = {}
+
+    def for_departments(self, department_ids):
+        """معرفات المستلمين مرتبة لمجموعة أقسام (المديرون فقط إذا لم يكن للعنصر قسم)"""
+        key = tuple(sorted(set(department_ids)))
+        users = self._memo.get(key)
+        if users is None:
+            users = set(self.admins)
+            for department_id in key:
+                users |= self.by_department.get(department_id, set())
+            users = self._memo[key] = tuple(sorted(users))
+        return users
+
+
+# ---------------------------------------------------------------------------
+# التنبيهات
+# ---------------------------------------------------------------------------
+
+def _insert_alerts(rows):
+    """
+    إدراج مفاتيح التنبيهات مع تجاهل الموجود منها
+
+    :return: مجموعة المفاتيح (entity, entity_id, expiry_date, threshold) التي أُدرجت الآن
+    """
+    from models import ExpiryAlert
+
+    if not rows:
+        return set()
+    table = ExpiryAlert.__table__
+    columns = (table.c.entity, table.c.entity_id, table.c.expiry_date, table.c.threshold)
+    dialect = db.session.connection().dialect
+    if dialect.name in ('postgresql', 'sqlite') and dialect.insert_executemany_returning:
+        if dialect.name == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        statement = dialect_insert(table).on_conflict_do_nothing(
+            index_elements=['entity', 'entity_id', 'expiry_date', 'threshold']).returning(*columns)
+        return {tuple(row) for row in db.session.execute(statement, rows)}
+
+    # قواعد أخرى: استبعاد الموجود ثم إدراج الباقي (المجدول يشغّل مسحاً واحداً في كل وقت)
+    existing = set()
+    for entity, entity_ids in _group(rows).items():
+        existing.update(tuple(row) for row in db.session.execute(
+            select(*columns).where(table.c.entity == entity, table.c.entity_id.in_(entity_ids))))
+    new_rows = [row for row in rows if _alert_key(row) not in existing]
+    if new_rows:
+        db.session.execute(table.insert(), new_rows)
+    return {_alert_key(row) for row in new_rows}
+
+
+def _alert_key(row):
+    return (row['entity'], row['entity_id'], row['expiry_date'], row['threshold'])
+
+
+def _group(rows):
+    groups = defaultdict(set)
+    for row in rows:
+        groups[row['entity']].add(row['entity_id'])
+    return groups
+
+
+def _save_watermark(source, start, end, stats, duration_ms):
+    from models import ExpiryScanWatermark
+
+    watermark = ExpiryScanWatermark.query.filter_by(source=source).first()
+    if watermark is None:
+        watermark = ExpiryScanWatermark(source=source)
+        db.session.add(watermark)
+    watermark.scanned_at = datetime.utcnow()
+    watermark.window_start = start
+    watermark.window_end = end
+    watermark.matched = stats['matched']
+    watermark.alerts = stats['alerts']
+    watermark.notifications = stats['notifications']
+    watermark.duration_ms = duration_ms
+
+
+def scan_source(source, today, recipients, dry_run=False):
+    """
+    مسح مصدر واحد وإنشاء تنبيهاته الجديدة (الحفظ مسؤولية المستدعي)
+
+    :return: dict بعدد العناصر المطابقة والتنبيهات والإشعارات الجديدة
+    """
+    from services import notification_hub
+
+    fetch, entity_type, action_url = SOURCES[source]
+    start = today - timedelta(days=EXPIRED_LOOKBACK_DAYS)
+    end = today + timedelta(days=THRESHOLDS[0])
+    started = time.monotonic()
+    stats = {'matched': 0, 'alerts': 0, 'notifications': 0}
+    now = datetime.utcnow()
+
+    for items in fetch(start, end):
+        stats['matched'] += len(items)
+        candidates = {}
+        for item in items:
+            threshold = threshold_for((item.expiry_date - today).days)
+            if threshold is None:
+                continue
+            users = recipients.for_departments(item.department_ids)
+            candidates[(source, item.entity_id, item.expiry_date, threshold)] = (item, users)
+        if not candidates:
+            continue
+        alert_rows = [{'entity': key[0], 'entity_id': key[1], 'expiry_date': key[2], 'threshold': key[3],
+                       'recipients': len(users), 'created_at': now}
+                      for key, (item, users) in candidates.items()]
+
+        if dry_run:
+            from models import ExpiryAlert
+            existing = set()
+            for entity, entity_ids in _group(alert_rows).items():
+                existing.update(tuple(row) for row in db.session.execute(
+                    select(ExpiryAlert.entity, ExpiryAlert.entity_id, ExpiryAlert.expiry_date,
+                           ExpiryAlert.threshold)
+                    .where(ExpiryAlert.entity == entity, ExpiryAlert.entity_id.in_(entity_ids))))
+            new_keys = set(candidates) - existing
+        else:
+            new_keys = _insert_alerts(alert_rows)
+
+        notifications = []
+        for key in new_keys:
+            item, users = candidates[key]
+            title, description, priority = _message(item.label, item.subject, (item.expiry_date - today).days)
+            url = action_url(item)
+            notifications.extend({
+                'user_id': user_id,
+                'notification_type': NOTIFICATION_TYPE,
+                'title': title,
+                'description': description,
+                'related_entity_type': entity_type,
+                'related_entity_id': item.entity_id,
+                'priority': priority,
+                'action_url': url,
+                'is_read': False,
+                'created_at': now,
+            } for user_id in users)
+        stats['alerts'] += len(new_keys)
+        if dry_run:
+            stats['notifications'] += len(notifications)
+        else:
+            stats['notifications'] += notification_hub.insert_many(notifications)
+
+    if not dry_run:
+        _save_watermark(source, start, end, stats, int((time.monotonic() - started) * 1000))
+    return stats
+
+
+def scan(today=None, sources=None, dry_run=False):
+    """
+    مسح كل المصادر (أو sources) وإنشاء التنبيهات الجديدة، مع حفظ كل مصدر في معاملته
+
+    :param dry_run: حساب ما سيُنشأ دون كتابة أي شيء
+    :return: dict المصدر -> {matched, alerts, notifications}
+    """
+    today = today or date.today()
+    recipients = Recipients()
+    results = OrderedDict()
+    failed = []
+    for source in sources or SOURCES:
+        try:
+            results[source] = scan_source(source, today, recipients, dry_run=dry_run)
+            if dry_run:
+                db.session.rollback()
+            else:
+                db.session.commit()
+        except Exception:
+            # مصدر فاشل لا يوقف بقية المصادر؛ يُعاد مسحه في التشغيل التالي
+            db.session.rollback()
+            logger.exception(f"خطأ في مسح انتهاء الصلاحيات للمصدر {source}")
+            failed.append(source)
+    if failed:
+        raise RuntimeError(f"فشل مسح المصادر: {', '.join(failed)}")
+    created = sum(stats['notifications'] for stats in results.values())
+    if created and not dry_run:
+        logger.info(f"ماسح انتهاء الصلاحيات: {created} إشعار جديد")
+    return results
+
+
+def watermarks():
+    """آخر مسح لكل مصدر"""
+    from models import ExpiryScanWatermark
+
+    return {
+        row.source: {
+            'scanned_at': row.scanned_at.isoformat() if row.scanned_at else None,
+            'window_start': row.window_start.isoformat(),
+            'window_end': row.window_end.isoformat(),
+            'matched': row.matched,
+            'alerts': row.alerts,
+            'notifications': row.notifications,
+            'duration_ms': row.duration_ms,
+        }
+        for row in ExpiryScanWatermark.query.order_by(ExpiryScanWatermark.source).all()
+    }
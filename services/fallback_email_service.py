@@ -1,26 +1,16 @@
 """
 خدمة إيميل احتياطية تعمل بدون خدمات خارجية
-تحفظ الإيميلات في ملفات محلية ويمكن إرسالها لاحقاً
+تضيف الإيميلات إلى قائمة الإرسال في قاعدة البيانات (services/email_queue.py)
+ويتولى العامل إرسالها لاحقاً عند توفر ناقل
 """
-import os
-import json
-import base64
-from datetime import datetime
 from typing import Dict, Any, List, Optional
 from flask import current_app
 
+from services.email_queue import EmailQueue
+
 
 class FallbackEmailService:
-    """خدمة إيميل احتياطية تحفظ الإيميلات محلياً"""
-    
-    def __init__(self):
-        self.emails_dir = "emails_queue"
-        self._ensure_email_directory()
-    
-    def _ensure_email_directory(self):
-        """إنشاء مجلد الإيميلات إن لم يكن موجوداً"""
-        if not os.path.exists(self.emails_dir):
-            os.makedirs(self.emails_dir)
+    """خدمة إيميل احتياطية تحفظ الإيميلات في قائمة الإرسال"""
     
     def send_email(
         self,
@@ -32,73 +22,25 @@ class FallbackEmailService:
         attachments: Optional[List[Dict[str, Any]]] = None
     ) -> Dict[str, Any]:
         """
-        حفظ الإيميل في مجلد محلي للإرسال لاحقاً
+        إضافة الإيميل إلى قائمة الإرسال ضمن معاملة المستدعي (يُرسل بعد أن يحفظها)
         """
         try:
-            # إنشاء معرف فريد للإيميل
-            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S_%f')
-            email_id = f"email_{timestamp}"
-            
-            # إعداد بيانات الإيميل
-            email_data = {
-                'id': email_id,
-                'to_email': to_email,
-                'from_email': from_email,
-                'from_name': from_name,
-                'subject': subject,
-                'html_content': html_content,
-                'created_at': datetime.now().isoformat(),
-                'status': 'queued',
-                'attachments': []
-            }
+            email = EmailQueue.enqueue(
+                to_email=to_email,
+                subject=subject,
+                html_content=html_content,
+                from_email=from_email,
+                from_name=from_name,
+                attachments=attachments,
+                commit=False
+            )
             
-            # معالجة المرفقات
-            if attachments:
-                for i, attachment in enumerate(attachments):
-                    if 'content' in attachment and 'filename' in attachment:
-                        # حفظ المرفق في ملف منفصل
-                        attachment_filename = f"{email_id}_attachment_{i}_{attachment['filename']}"
-                        attachment_path = os.path.join(self.emails_dir, attachment_filename)
-                        
-                        # كتابة محتوى المرفق
-                        if isinstance(attachment['content'], bytes):
-                            with open(attachment_path, 'wb') as f:
-                                f.write(attachment['content'])
-                        else:
-                            # إذا كان base64
-                            try:
-                                content_bytes = base64.b64decode(attachment['content'])
-                                with open(attachment_path, 'wb') as f:
-                                    f.write(content_bytes)
-                            except Exception:
-                                # إذا فشل، احفظه كنص
-                                with open(attachment_path, 'w', encoding='utf-8') as f:
-                                    f.write(str(attachment['content']))
-                        
-                        email_data['attachments'].append({
-                            'filename': attachment['filename'],
-                            'content_type': attachment.get('content_type', 'application/octet-stream'),
-                            'file_path': attachment_path,
-                            'size': os.path.getsize(attachment_path) if os.path.exists(attachment_path) else 0
-                        })
-            
-            # حفظ بيانات الإيميل
-            email_file_path = os.path.join(self.emails_dir, f"{email_id}.json")
-            with open(email_file_path, 'w', encoding='utf-8') as f:
-                json.dump(email_data, f, ensure_ascii=False, indent=2)
-            
-            # إنشاء ملف HTML للعرض
-            html_file_path = os.path.join(self.emails_dir, f"{email_id}.html")
-            with open(html_file_path, 'w', encoding='utf-8') as f:
-                f.write(html_content)
-            
-            current_app.logger.info(f'تم حفظ الإيميل محلياً - ID: {email_id}')
+            current_app.logger.info(f'تم حفظ الإيميل في قائمة الإرسال - ID: {email.message_id}')
             
             return {
                 'success': True,
-                'message_id': email_id,
-                'message': f'تم حفظ الإيميل محلياً وسيتم إرساله لاحقاً إلى {to_email}',
-                'saved_path': email_file_path
+                'message_id': email.message_id,
+                'message': f'تم حفظ الإيميل محلياً وسيتم إرساله لاحقاً إلى {to_email}'
             }
             
         except Exception as e:
@@ -108,58 +50,22 @@ class FallbackEmailService:
                 'error': f'خطأ في حفظ الإيميل: {str(e)}'
             }
     
-    def get_queued_emails(self) -> List[Dict[str, Any]]:
-        """جلب قائمة الإيميلات المحفوظة"""
-        emails = []
-        
-        if not os.path.exists(self.emails_dir):
-            return emails
-        
-        for filename in os.listdir(self.emails_dir):
-            if filename.endswith('.json'):
-                try:
-                    file_path = os.path.join(self.emails_dir, filename)
-                    with open(file_path, 'r', encoding='utf-8') as f:
-                        email_data = json.load(f)
-                        emails.append(email_data)
-                except Exception as e:
-                    current_app.logger.error(f'خطأ في قراءة الإيميل {filename}: {e}')
-        
-        return sorted(emails, key=lambda x: x.get('created_at', ''), reverse=True)
+    def get_queued_emails(self, page: int = 1, per_page: int = 25, status: Optional[str] = None):
+        """صفحة من الإيميلات المحفوظة (الأحدث أولاً)"""
+        return EmailQueue.list_emails(page=page, per_page=per_page, status=status)
     
     def get_email_details(self, email_id: str) -> Optional[Dict[str, Any]]:
         """جلب تفاصيل إيميل محدد"""
-        email_file_path = os.path.join(self.emails_dir, f"{email_id}.json")
-        
-        if not os.path.exists(email_file_path):
-            return None
-        
-        try:
-            with open(email_file_path, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except Exception as e:
-            current_app.logger.error(f'خطأ في قراءة تفاصيل الإيميل {email_id}: {e}')
-            return None
+        email = EmailQueue.get(email_id)
+        return EmailQueue.to_dict(email) if email else None
     
     def delete_email(self, email_id: str) -> bool:
         """حذف إيميل من القائمة"""
         try:
-            email_file_path = os.path.join(self.emails_dir, f"{email_id}.json")
-            html_file_path = os.path.join(self.emails_dir, f"{email_id}.html")
-            
-            # حذف الملفات الأساسية
-            if os.path.exists(email_file_path):
-                os.remove(email_file_path)
-            if os.path.exists(html_file_path):
-                os.remove(html_file_path)
-            
-            # حذف المرفقات
-            email_data = self.get_email_details(email_id)
-            if email_data and 'attachments' in email_data:
-                for attachment in email_data['attachments']:
-                    if 'file_path' in attachment and os.path.exists(attachment['file_path']):
-                        os.remove(attachment['file_path'])
-            
+            email = EmailQueue.get(email_id)
+            if not email:
+                return False
+            EmailQueue.delete(email)
             return True
         except Exception as e:
             current_app.logger.error(f'خطأ في حذف الإيميل {email_id}: {e}')
@@ -11,6 +11,7 @@ from pillow_heif import register_heif_opener
 register_heif_opener()
 from flask import current_app
 from utils.audit_logger import log_activity
+from services.blob_store import BlobStore
 from flask_login import current_user
 
 class FileService:
@@ -39,7 +40,7 @@ class FileService:
     
     @staticmethod
     def generate_unique_filename(filename):
-        """إنشاء اسم ملف فريد"""
+        """إنشاء اسم ملف فريد (للملفات المؤقتة فقط؛ الملفات المرفوعة تُحفظ في BlobStore)"""
         file_extension = filename.rsplit('.', 1)[1].lower()
         unique_name = str(uuid.uuid4())
         return f"{unique_name}.{file_extension}"
@@ -52,8 +53,14 @@ class FileService:
         return directory_path
     
     @staticmethod
-    def save_uploaded_file(file, upload_folder, max_size=None):
-        """حفظ الملف المرفوع"""
+    def save_uploaded_file(file, upload_folder=None, max_size=None, image_options=None):
+        """
+        حفظ الملف المرفوع في مخزن الملفات المعتمد على المحتوى
+
+        يُرجع (True, المسار النسبي) حيث يشير المسار إلى نسخة واحدة مشتركة لكل المحتوى
+        المتطابق. المعامل upload_folder محفوظ للتوافق ولم يعد يحدد مكان الحفظ.
+        image_options (مثل max_size) تجعل الصور تُحسّن قبل تخزينها (BlobStore.save_image).
+        """
         if not file or file.filename == '':
             return False, "لم يتم اختيار ملف"
         
@@ -65,16 +72,14 @@ class FileService:
             return False, f"حجم الملف كبير جداً. الحد الأقصى: {max_size // (1024*1024)}MB"
         
         try:
-            # إنشاء مجلد الرفع
-            FileService.create_upload_directory(upload_folder)
-            
-            # إنشاء اسم ملف فريد
+            # حفظ الملف مع حساب بصمته أثناء الكتابة
             secure_name = secure_filename(file.filename)
-            unique_filename = FileService.generate_unique_filename(secure_name)
-            file_path = os.path.join(upload_folder, unique_filename)
-            
-            # حفظ الملف
-            file.save(file_path)
+            if image_options is not None:
+                file_path, created = BlobStore.save_image(file, secure_name, **image_options)
+            else:
+                file_path, created = BlobStore.save(file, secure_name)
+            if not file_path:
+                return False, "الملف فارغ"
             
             # تسجيل العملية في السجل
             log_activity(
@@ -82,10 +87,10 @@ class FileService:
                 action='file_upload',
                 entity_type='file',
                 entity_id=None,
-                details=f'تم رفع الملف: {secure_name} -> {unique_filename}'
+                details=f'تم رفع الملف: {secure_name} -> {file_path}' + ('' if created else ' (ملف مكرر)')
             )
             
-            return True, unique_filename
+            return True, file_path
             
         except Exception as e:
             log_activity(
@@ -135,6 +140,11 @@ class FileService:
     @staticmethod
     def delete_file(file_path):
         """حذف ملف من النظام"""
+        # ملفات المخزن مشتركة بين عدة سجلات: يُنقص عداد المراجع فقط
+        if BlobStore.parse_path(file_path):
+            BlobStore.release(file_path)
+            return True
+        
         try:
             if os.path.exists(file_path):
                 os.remove(file_path)
@@ -182,14 +192,11 @@ class FileService:
         success, result = FileService.save_uploaded_file(
             file, 
             upload_folder, 
-            max_size=FileService.MAX_IMAGE_SIZE
+            max_size=FileService.MAX_IMAGE_SIZE,
+            image_options={'max_size': 800}
         )
         
         if success:
-            # تحسين الصورة
-            image_path = os.path.join(upload_folder, result)
-            FileService.resize_image(image_path)
-            
             return True, result
         
         return False, result
@@ -0,0 +1,211 @@
+"""
+ترحيل القيود المحاسبية دفعة واحدة
+
+معالجة الرواتب ومصروفات المركبات كانت تنشئ Transaction و TransactionEntry عبر ORM لكل
+موظف مع flush بعد كل قيد للحصول على رقمه، فرواتب آلاف الموظفين تعني آلاف الذهابات لقاعدة
+البيانات. post() تستقبل قائمة قيود متوازنة وتقوم بما يلي في معاملة واحدة:
+
+- التحقق من كل القيود مرة واحدة: الحسابات (بالمعرف أو بالرمز) باستعلام واحد ويجب أن تكون
+  نشطة، المبالغ موجبة، وتساوي المدين والدائن في كل قيد. أي خطأ يرفض الدفعة كاملة
+- حجز أرقام القيود كتلة واحدة بتحديث next_transaction_number مرة واحدة (قفل صف الإعدادات
+  حتى نهاية المعاملة فلا تتكرر الأرقام بين طلبين متزامنين)
+- إدخال رؤوس القيود بأمر insert واحد ثم كل التفاصيل بأمر insert واحد
+- تحديث أرصدة الحسابات ولقطاتها الشهرية (ledger_balances) بالمجاميع مباشرة، لأن الإدخال
+  المباشر لا يمر بأحداث ORM
+
+الحفظ (commit) على المستدعي.
+"""
+import logging
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+
+from sqlalchemy import func, insert, or_, select, update
+
+from app import db
+from models_accounting import Account, AccountingSettings, EntryType, FiscalYear, Transaction, TransactionEntry
+from services import ledger_balances
+
+logger = logging.getLogger(__name__)
+
+CENT = Decimal('0.01')
+
+# حقول رأس القيد المقبولة من المستدعي
+HEADER_FIELDS = ('transaction_date', 'transaction_type', 'description', 'reference_number', 'cost_center_id',
+                 'vendor_id', 'customer_id', 'employee_id', 'vehicle_id')
+
+
+class PostingError(ValueError):
+    """رفض دفعة القيود؛ errors قائمة رسائل لكل قيد غير صالح"""
+
+    def __init__(self, errors):
+        self.errors = errors
+        super().__init__('؛ '.join(errors[:5]) + (f" (و{len(errors) - 5} أخطاء أخرى)" if len(errors) > 5 else ''))
+
+
+def debit(account, amount, description=None, cost_center_id=None):
+    """سطر مدين؛ account معرف الحساب (int) أو رمزه (str)"""
+    return {'account': account, 'entry_type': EntryType.DEBIT, 'amount': amount,
+            'description': description, 'cost_center_id': cost_center_id}
+
+
+def credit(account, amount, description=None, cost_center_id=None):
+    """سطر دائن؛ account معرف الحساب (int) أو رمزه (str)"""
+    return {'account': account, 'entry_type': EntryType.CREDIT, 'amount': amount,
+            'description': description, 'cost_center_id': cost_center_id}
+
+
+def _amount(value):
+    try:
+        return Decimal(str(value)).quantize(CENT)
+    except (InvalidOperation, TypeError, ValueError):
+        return None
+
+
+def _resolve_accounts(entries):
+    """{معرف أو رمز: (المعرف، نشط)} لكل الحسابات المذكورة باستعلام واحد"""
+    ids, codes = set(), set()
+    for entry in entries:
+        for line in entry.get('lines') or ():
+            (codes if isinstance(line['account'], str) else ids).add(line['account'])
+    if not ids and not codes:
+        return {}
+    conditions = []
+    if ids:
+        conditions.append(Account.id.in_(ids))
+    if codes:
+        conditions.append(Account.code.in_(codes))
+    resolved = {}
+    for account_id, code, is_active in db.session.execute(
+            select(Account.id, Account.code, Account.is_active).where(or_(*conditions))):
+        if account_id in ids:
+            resolved[account_id] = (account_id, is_active)
+        if code in codes:
+            resolved[code] = (account_id, is_active)
+    return resolved
+
+
+def validate(entries):
+    """
+    التحقق من كل القيود دفعة واحدة
+
+    :return: قائمة [(رأس القيد، [(الحساب، النوع، المبلغ، الوصف، مركز التكلفة)], الإجمالي)]
+    :raises PostingError: بكل الأخطاء إن وُجدت
+    """
+    accounts = _resolve_accounts(entries)
+    errors = []
+    prepared = []
+    for index, entry in enumerate(entries, 1):
+        label = entry.get('description') or f"القيد {index}"
+        lines = entry.get('lines') or ()
+        if not entry.get('transaction_date') or not entry.get('transaction_type'):
+            errors.append(f"{label}: التاريخ ونوع القيد مطلوبان")
+            continue
+        if len(lines) < 2:
+            errors.append(f"{label}: يجب أن يحتوي القيد على سطرين على الأقل")
+            continue
+
+        rows = []
+        totals = {EntryType.DEBIT: Decimal('0'), EntryType.CREDIT: Decimal('0')}
+        for line in lines:
+            amount = _amount(line.get('amount'))
+            account = accounts.get(line['account'])
+            if amount is None or amount <= 0:
+                errors.append(f"{label}: مبلغ غير صالح ({line.get('amount')})")
+            elif account is None:
+                errors.append(f"{label}: الحساب {line['account']} غير موجود")
+            elif not account[1]:
+                errors.append(f"{label}: الحساب {line['account']} غير نشط")
+            else:
+                totals[line['entry_type']] += amount
+                rows.append((account[0], line['entry_type'], amount,
+                             line.get('description') or entry.get('description'), line.get('cost_center_id')))
+        if len(rows) != len(lines):
+            continue
+        if totals[EntryType.DEBIT] != totals[EntryType.CREDIT]:
+            errors.append(f"{label}: القيد غير متوازن (مدين {totals[EntryType.DEBIT]} - دائن {totals[EntryType.CREDIT]})")
+            continue
+        prepared.append(({field: entry.get(field) for field in HEADER_FIELDS}, rows, totals[EntryType.DEBIT]))
+
+    if errors:
+        raise PostingError(errors)
+    return prepared
+
+
+def allocate_numbers(count):
+    """
+    حجز count رقماً متتالياً للقيود بتحديث واحد لعداد الإعدادات
+
+    :return: قائمة أرقام القيود
+    """
+    table = AccountingSettings.__table__
+    settings_id = db.session.execute(select(table.c.id).order_by(table.c.id).limit(1)).scalar()
+    if settings_id is None:
+        settings = AccountingSettings(company_name='شركة نُظم', next_transaction_number=1)
+        db.session.add(settings)
+        db.session.flush()
+        settings_id = settings.id
+
+    # التحديث يقفل الصف حتى نهاية المعاملة، فالطلب المتزامن ينتظر ثم يقرأ العداد الجديد
+    db.session.execute(
+        update(table).where(table.c.id == settings_id)
+        .values(next_transaction_number=func.coalesce(table.c.next_transaction_number, 1) + count))
+    end, prefix = db.session.execute(
+        select(table.c.next_transaction_number, table.c.transaction_prefix).where(table.c.id == settings_id)).one()
+    # إعادة تحميل الإعدادات إن كانت محملة في الجلسة حتى لا يُكتب العداد القديم فوق الجديد
+    for obj in db.session.identity_map.values():
+        if isinstance(obj, AccountingSettings):
+            db.session.expire(obj, ['next_transaction_number'])
+    prefix = prefix or 'JV'
+    return [f"{prefix}{number:06d}" for number in range(end - count, end)]
+
+
+def post(entries, created_by_id, approved=True, fiscal_year=None):
+    """
+    ترحيل قائمة قيود متوازنة في المعاملة الحالية
+
+    :param entries: قوائم dict فيها حقول رأس القيد (transaction_date, transaction_type,
+                    description, employee_id, vehicle_id, ...) و lines من debit()/credit()
+    :param created_by_id: معرف المستخدم المنشئ (ويُعتبر المعتمد إذا approved)
+    :param fiscal_year: السنة المالية (افتراضياً النشطة)
+    :return: قائمة (معرف القيد، رقمه) بنفس ترتيب entries
+    :raises PostingError: إذا فشل التحقق من أي قيد (لا يُرحّل شيء)
+    """
+    if not entries:
+        return []
+    prepared = validate(entries)
+
+    if fiscal_year is None:
+        fiscal_year = FiscalYear.query.filter_by(is_active=True).first()
+        if fiscal_year is None:
+            raise PostingError(['لا توجد سنة مالية نشطة'])
+
+    numbers = allocate_numbers(len(prepared))
+    now = datetime.utcnow()
+    headers = []
+    for (header, _, total), number in zip(prepared, numbers):
+        headers.append(dict(header, transaction_number=number, total_amount=total,
+                            fiscal_year_id=fiscal_year.id, created_by_id=created_by_id,
+                            is_approved=approved, approval_date=now if approved else None,
+                            approved_by_id=created_by_id if approved else None,
+                            is_posted=False, created_at=now, updated_at=now))
+
+    transactions = Transaction.__table__
+    result = db.session.execute(
+        insert(transactions).returning(transactions.c.id, transactions.c.transaction_number), headers)
+    ids = dict((number, transaction_id) for transaction_id, number in result)
+
+    lines = []
+    deltas = {}
+    for (header, rows, _), number in zip(prepared, numbers):
+        transaction_id = ids[number]
+        for account_id, entry_type, amount, description, cost_center_id in rows:
+            lines.append({'transaction_id': transaction_id, 'account_id': account_id, 'entry_type': entry_type,
+                          'amount': amount, 'description': description, 'cost_center_id': cost_center_id,
+                          'created_at': now})
+            if approved:
+                ledger_balances.accumulate(deltas, account_id, header['transaction_date'], entry_type, amount)
+    db.session.execute(insert(TransactionEntry.__table__), lines)
+    ledger_balances.apply(db.session.connection(), deltas)
+
+    logger.info(f"تم ترحيل {len(headers)} قيد ({len(lines)} سطر) بالأرقام {numbers[0]} - {numbers[-1]}")
+    return [(ids[number], number) for number in numbers]
@@ -0,0 +1,428 @@
+"""
+أرصدة الحسابات المحفوظة ولقطاتها الشهرية
+
+ميزان المراجعة والميزانية العمومية وصفحات الأرصدة كانت تجمع كل TransactionEntry مع
+Transaction في كل طلب، و Account.balance كان يُعدّل يدوياً في بعض المسارات فقط (وبإشارات
+مختلفة) فلا يطابق القيود. الآن:
+
+- جدول account_period_balances يحفظ مجموع المدين والدائن لكل حساب في كل شهر للقيود
+  المعتمدة فقط
+- يُحدّث تلقائياً عند كل حفظ (flush) يمس قيداً أو تفاصيله: الإنشاء، الاعتماد وإلغاؤه، تغيير
+  التاريخ أو المبلغ أو الحساب، والحذف. الفرق = مساهمة القيود المتأثرة بعد الحفظ ناقص
+  مساهمتها قبله، ويُكتب في نفس المعاملة فيُلغى معها عند التراجع
+- Account.balance يُحدّث بنفس الفرق بإشارة طبيعة الحساب (مدين للأصول والمصروفات،
+  دائن لغيرها)، فلا يجوز تعديله يدوياً عند إنشاء القيود
+- التقارير تقرأ لقطات الأشهر الكاملة (صف لكل حساب وشهر) وتجمع من القيود أيام الأشهر
+  الجزئية في طرفي الفترة فقط
+- الأمر flask ledger-balances يتحقق من مطابقة اللقطات للقيود ويعيد بناءها (--rebuild)
+- عند الترقية (الجدول فارغ والقيود المعتمدة موجودة) يُبنى الجدول و Account.balance مرة
+  واحدة بمهمة المجدول ledger-backfill على القائد (ensure_backfill)، لا عند استيراد التطبيق
+  في كل عامل وأمر flask، وهو ما يعادل تشغيل flask ledger-balances --rebuild
+
+التعديلات الجماعية (query.update على القيود) لا تمر بهذه الأحداث؛ يُعاد البناء بعدها.
+"""
+import logging
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+from sqlalchemy import bindparam, delete, event, func, insert, inspect, select, text, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+from app import db
+from models_accounting import Account, AccountPeriodBalance, AccountType, EntryType, Transaction, TransactionEntry
+
+logger = logging.getLogger(__name__)
+
+# الحسابات ذات الطبيعة المدينة
+DEBIT_NORMAL = (AccountType.ASSETS, AccountType.EXPENSES)
+
+ZERO = Decimal('0')
+
+
+def month_start(day):
+    return day.replace(day=1)
+
+
+def next_month(day):
+    return (day.replace(day=1) + timedelta(days=32)).replace(day=1)
+
+
+def month_end(day):
+    return next_month(day) - timedelta(days=1)
+
+
+def natural_balance(account_type, debit, credit):
+    """الرصيد بإشارة طبيعة الحساب"""
+    debit, credit = debit or ZERO, credit or ZERO
+    return debit - credit if account_type in DEBIT_NORMAL else credit - debit
+
+
+def _add(totals, key, debit, credit):
+    entry = totals.setdefault(key, [ZERO, ZERO])
+    entry[0] += Decimal(debit or 0)
+    entry[1] += Decimal(credit or 0)
+
+
+def _split(entry_type, amount):
+    return (amount, ZERO) if entry_type == EntryType.DEBIT else (ZERO, amount)
+
+
+def accumulate(deltas, account_id, day, entry_type, amount):
+    """إضافة سطر قيد معتمد إلى فروق {(الحساب، الشهر): [مدين، دائن]} تمهيداً لـ apply()"""
+    _add(deltas, (account_id, month_start(day)), *_split(entry_type, amount))
+
+
+# ---------------------------------------------------------------------------
+# التحديث عند حفظ القيود
+# ---------------------------------------------------------------------------
+
+def _contributions(connection, transaction_ids):
+    """{(الحساب، الشهر): [مدين، دائن]} للقيود المعتمدة من المعاملات المحددة كما في قاعدة البيانات"""
+    totals = {}
+    ids = sorted(i for i in transaction_ids if i is not None)
+    if not ids:
+        return totals
+    query = (
+        select(TransactionEntry.account_id, Transaction.transaction_date,
+               TransactionEntry.entry_type, func.sum(TransactionEntry.amount))
+        .join(Transaction, Transaction.id == TransactionEntry.transaction_id)
+        .where(Transaction.id.in_(ids), Transaction.is_approved == True)  # noqa: E712
+        .group_by(TransactionEntry.account_id, Transaction.transaction_date, TransactionEntry.entry_type)
+    )
+    for account_id, day, entry_type, amount in connection.execute(query):
+        _add(totals, (account_id, month_start(day)), *_split(entry_type, amount))
+    return totals
+
+
+def _history_values(obj, attribute):
+    history = inspect(obj).attrs[attribute].history
+    return {v for values in (history.added, history.unchanged, history.deleted) for v in values or () if v is not None}
+
+
+@event.listens_for(Session, 'before_flush')
+def _before_flush(session, flush_context, instances):
+    touched = set()
+    for obj in list(session.dirty) + list(session.deleted):
+        if isinstance(obj, TransactionEntry):
+            touched |= _history_values(obj, 'transaction_id')
+        elif isinstance(obj, Transaction) and obj.id is not None:
+            touched.add(obj.id)
+    for obj in session.new:
+        if isinstance(obj, TransactionEntry) and obj.transaction_id is not None:
+            touched.add(obj.transaction_id)
+    if not touched and not any(isinstance(obj, (Transaction, TransactionEntry)) for obj in session.new):
+        return
+    session.info['ledger_before'] = (touched, _contributions(session.connection(), touched))
+
+
+@event.listens_for(Session, 'after_flush')
+def _after_flush(session, flush_context):
+    pending = session.info.pop('ledger_before', None)
+    if pending is None:
+        return
+    touched, before = pending
+    touched = set(touched)
+    for obj in list(session.new) + list(session.dirty):
+        if isinstance(obj, Transaction):
+            touched.add(obj.id)
+        elif isinstance(obj, TransactionEntry):
+            touched.add(obj.transaction_id)
+
+    deltas = {}
+    for key, (debit, credit) in _contributions(session.connection(), touched).items():
+        _add(deltas, key, debit, credit)
+    for key, (debit, credit) in before.items():
+        _add(deltas, key, -debit, -credit)
+    apply(session.connection(), deltas)
+
+
+def _upsert(connection):
+    table = AccountPeriodBalance.__table__
+    dialect = connection.dialect.name
+    if dialect not in ('postgresql', 'sqlite'):
+        return None
+    stmt = (postgresql if dialect == 'postgresql' else sqlite).insert(table)
+    return stmt.on_conflict_do_update(
+        index_elements=['account_id', 'period'],
+        set_={'debit': table.c.debit + stmt.excluded.debit,
+              'credit': table.c.credit + stmt.excluded.credit,
+              'updated_at': stmt.excluded.updated_at},
+    )
+
+
+def apply(connection, deltas):
+    """إضافة فروق {(الحساب، الشهر): [مدين، دائن]} إلى اللقطات وإلى Account.balance"""
+    deltas = {key: value for key, value in deltas.items() if value[0] or value[1]}
+    if not deltas:
+        return
+    now = datetime.utcnow()
+    table = AccountPeriodBalance.__table__
+    rows = [{'account_id': account_id, 'period': period, 'debit': debit, 'credit': credit, 'updated_at': now}
+            for (account_id, period), (debit, credit) in sorted(deltas.items())]
+
+    stmt = _upsert(connection)
+    if stmt is not None:
+        connection.execute(stmt, rows)
+    else:
+        for row in rows:
+            result = connection.execute(
+                update(table)
+                .where(table.c.account_id == row['account_id'], table.c.period == row['period'])
+                .values(debit=table.c.debit + row['debit'], credit=table.c.credit + row['credit'],
+                        updated_at=now))
+            if result.rowcount == 0:
+                connection.execute(insert(table).values(**row))
+
+    per_account = {}
+    for (account_id, _), (debit, credit) in deltas.items():
+        _add(per_account, account_id, debit, credit)
+    accounts = Account.__table__
+    types = dict(connection.execute(
+        select(accounts.c.id, accounts.c.account_type).where(accounts.c.id.in_(per_account))).all())
+    connection.execute(
+        update(accounts)
+        .where(accounts.c.id == bindparam('_id'))
+        .values(balance=func.coalesce(accounts.c.balance, 0) + bindparam('_delta')),
+        [{'_id': account_id, '_delta': natural_balance(types.get(account_id), debit, credit)}
+         for account_id, (debit, credit) in sorted(per_account.items())]
+    )
+
+
+# ---------------------------------------------------------------------------
+# القراءة
+# ---------------------------------------------------------------------------
+
+def _journal_totals(totals, from_date, to_date):
+    """إضافة مجاميع القيود بين تاريخين (للأشهر الجزئية في طرفي الفترة)"""
+    query = (
+        select(TransactionEntry.account_id, TransactionEntry.entry_type, func.sum(TransactionEntry.amount))
+        .join(Transaction, Transaction.id == TransactionEntry.transaction_id)
+        .where(Transaction.is_approved == True,  # noqa: E712
+               Transaction.transaction_date >= from_date, Transaction.transaction_date <= to_date)
+        .group_by(TransactionEntry.account_id, TransactionEntry.entry_type)
+    )
+    for account_id, entry_type, amount in db.session.execute(query):
+        _add(totals, account_id, *_split(entry_type, amount))
+
+
+def _snapshot_totals(totals, first_period=None, before_period=None):
+    table = AccountPeriodBalance.__table__
+    conditions = []
+    if first_period is not None:
+        conditions.append(table.c.period >= first_period)
+    if before_period is not None:
+        conditions.append(table.c.period < before_period)
+    query = (select(table.c.account_id, func.sum(table.c.debit), func.sum(table.c.credit))
+             .where(*conditions).group_by(table.c.account_id))
+    for account_id, debit, credit in db.session.execute(query):
+        _add(totals, account_id, debit, credit)
+
+
+def period_totals(from_date=None, to_date=None):
+    """
+    مجاميع القيود المعتمدة لكل حساب بين تاريخين (شاملين؛ None = بلا حد)
+
+    :return: {معرف الحساب: [مدين، دائن]}
+    """
+    totals = {}
+    if from_date is not None and to_date is not None:
+        if from_date > to_date:
+            return totals
+        if month_start(from_date) == month_start(to_date) and (from_date.day != 1 or to_date != month_end(to_date)):
+            _journal_totals(totals, from_date, to_date)
+            return totals
+
+    first_period = None
+    if from_date is not None:
+        if from_date.day == 1:
+            first_period = from_date
+        else:
+            first_period = next_month(from_date)
+            _journal_totals(totals, from_date, month_end(from_date))
+
+    before_period = None
+    if to_date is not None:
+        if to_date == month_end(to_date):
+            before_period = next_month(to_date)
+        else:
+            before_period = month_start(to_date)
+            _journal_totals(totals, before_period, to_date)
+
+    if first_period is None or before_period is None or first_period < before_period:
+        _snapshot_totals(totals, first_period, before_period)
+    return totals
+
+
+def balances_as_of(as_of=None):
+    """مجاميع كل حساب من أول القيود حتى التاريخ"""
+    return period_totals(None, as_of)
+
+
+def rollup(totals, active_only=True):
+    """
+    مجاميع كل حساب شاملة حساباته الفرعية عبر parent_id
+
+    :return: {معرف الحساب: [مدين، دائن]} لكل الحسابات
+    """
+    accounts = {row.id: row for row in db.session.execute(
+        select(Account.id, Account.parent_id, Account.is_active))}
+    rolled = {account_id: [ZERO, ZERO] for account_id in accounts}
+    for account_id, (debit, credit) in totals.items():
+        seen = set()
+        current = accounts.get(account_id)
+        if current is None or (active_only and not current.is_active):
+            continue
+        while current is not None and current.id not in seen:
+            seen.add(current.id)
+            rolled[current.id][0] += debit
+            rolled[current.id][1] += credit
+            parent = accounts.get(current.parent_id)
+            if parent is not None and active_only and not parent.is_active:
+                break
+            current = parent
+    return rolled
+
+
+def account_balance(account, include_children=True, as_of=None):
+    """رصيد الحساب بإشارة طبيعته، شاملاً حساباته الفرعية النشطة"""
+    totals = balances_as_of(as_of)
+    if include_children:
+        totals = rollup(totals)
+    debit, credit = totals.get(account.id, (ZERO, ZERO))
+    return natural_balance(account.account_type, debit, credit)
+
+
+def monthly_balances(account, year):
+    """الرصيد التراكمي للحساب في نهاية كل شهر من السنة (12 قيمة) من اللقطات"""
+    table = AccountPeriodBalance.__table__
+    opening = [ZERO, ZERO]
+    months = {}
+    query = (select(table.c.period, table.c.debit, table.c.credit)
+             .where(table.c.account_id == account.id, table.c.period < date(year + 1, 1, 1)))
+    for period, debit, credit in db.session.execute(query):
+        if period.year < year:
+            opening[0] += Decimal(debit or 0)
+            opening[1] += Decimal(credit or 0)
+        else:
+            months[period.month] = (Decimal(debit or 0), Decimal(credit or 0))
+
+    balances = []
+    debit, credit = opening
+    for month in range(1, 13):
+        month_debit, month_credit = months.get(month, (ZERO, ZERO))
+        debit += month_debit
+        credit += month_credit
+        balances.append(natural_balance(account.account_type, debit, credit))
+    return balances
+
+
+# ---------------------------------------------------------------------------
+# التحقق وإعادة البناء
+# ---------------------------------------------------------------------------
+
+def _expected():
+    """اللقطات كما يجب أن تكون محسوبة من كل القيود المعتمدة"""
+    totals = {}
+    query = (
+        select(TransactionEntry.account_id, Transaction.transaction_date,
+               TransactionEntry.entry_type, func.sum(TransactionEntry.amount))
+        .join(Transaction, Transaction.id == TransactionEntry.transaction_id)
+        .where(Transaction.is_approved == True)  # noqa: E712
+        .group_by(TransactionEntry.account_id, Transaction.transaction_date, TransactionEntry.entry_type)
+    )
+    for account_id, day, entry_type, amount in db.session.execute(query):
+        _add(totals, (account_id, month_start(day)), *_split(entry_type, amount))
+    return totals
+
+
+def _expected_balances(expected):
+    per_account = {}
+    for (account_id, _), (debit, credit) in expected.items():
+        _add(per_account, account_id, debit, credit)
+    result = {}
+    for account_id, account_type in db.session.execute(select(Account.id, Account.account_type)).all():
+        debit, credit = per_account.get(account_id, (ZERO, ZERO))
+        result[account_id] = natural_balance(account_type, debit, credit)
+    return result
+
+
+def _cents(value):
+    return Decimal(value or 0).quantize(Decimal('0.01'))
+
+
+def verify():
+    """
+    مقارنة اللقطات و Account.balance بالقيود
+
+    :return: {'periods': [(الحساب، الشهر، المتوقع، المحفوظ)], 'balances': [(الحساب، المتوقع، المحفوظ)]}
+    """
+    expected = _expected()
+    table = AccountPeriodBalance.__table__
+    stored = {(row.account_id, row.period): (row.debit, row.credit)
+              for row in db.session.execute(select(table.c.account_id, table.c.period, table.c.debit, table.c.credit))}
+
+    periods = []
+    for key in sorted(set(expected) | set(stored)):
+        want = tuple(_cents(v) for v in expected.get(key, (ZERO, ZERO)))
+        have = tuple(_cents(v) for v in stored.get(key, (ZERO, ZERO)))
+        if want != have:
+            periods.append((key[0], key[1], want, have))
+
+    balances = []
+    current = dict(db.session.execute(select(Account.id, Account.balance)).all())
+    for account_id, want in sorted(_expected_balances(expected).items()):
+        if _cents(want) != _cents(current.get(account_id)):
+            balances.append((account_id, _cents(want), _cents(current.get(account_id))))
+    return {'periods': periods, 'balances': balances}
+
+
+def rebuild():
+    """
+    إعادة بناء كل اللقطات و Account.balance من القيود المعتمدة في معاملة واحدة
+
+    :return: عدد صفوف اللقطات
+    """
+    if db.engine.dialect.name == 'postgresql':
+        # حفظ القيود المتزامن ينتظر انتهاء البناء ثم يضيف فرقه فوق النتيجة
+        db.session.execute(text('LOCK TABLE account_period_balances IN EXCLUSIVE MODE'))
+    expected = _expected()
+    table = AccountPeriodBalance.__table__
+    db.session.execute(delete(table))
+
+    now = datetime.utcnow()
+    rows = [{'account_id': account_id, 'period': period, 'debit': debit, 'credit': credit, 'updated_at': now}
+            for (account_id, period), (debit, credit) in sorted(expected.items())]
+    if rows:
+        db.session.execute(insert(table), rows)
+
+    accounts = Account.__table__
+    balances = _expected_balances(expected)
+    if balances:
+        db.session.execute(
+            update(accounts).where(accounts.c.id == bindparam('_id')).values(balance=bindparam('_balance')),
+            [{'_id': account_id, '_balance': balance} for account_id, balance in balances.items()]
+        )
+    db.session.commit()
+    logger.info(f"تمت إعادة بناء أرصدة الحسابات: {len(rows)} لقطة شهرية")
+    return len(rows)
+
+
+def ensure_backfill():
+    """
+    البناء الأول للقطات بعد الترقية: الجدول فارغ وتوجد قيود معتمدة
+
+    بدونه تبدأ التقارير من الصفر وتضاف إليها فروق القيود الجديدة فقط.
+
+    :return: عدد صفوف اللقطات المبنية، أو None إذا لم يلزم البناء
+    """
+    table = AccountPeriodBalance.__table__
+    if db.session.execute(select(table.c.account_id).limit(1)).first() is not None:
+        return None
+    approved = db.session.execute(
+        select(Transaction.id).where(Transaction.is_approved == True).limit(1)).first()  # noqa: E712
+    if approved is None:
+        return None
+    logger.info("جدول أرصدة الحسابات فارغ مع وجود قيود معتمدة، جاري البناء الأول")
+    return rebuild()
+
@@ -0,0 +1,347 @@
+"""
+آخر مواقع الموظفين في الذاكرة وبثها كتغييرات فقط
+
+/mobile/api/live-locations كان ينفذ استعلام "آخر موقع" لكل موظف في كل استطلاع (كل 5-10
+ثوانٍ من كل خريطة مفتوحة) ويعيد تحميل كل الدوائر الجغرافية وأقسام كل موظف. الآن:
+
+- آخر موقع لكل موظف محفوظ في الذاكرة: يُحمّل مرة واحدة، ثم يُحدَّث فوراً عند حفظ موقع
+  جديد في نفس العملية (after_commit)، وكل SYNC_INTERVAL ثانية من قاعدة البيانات بالمواقع
+  ذات المعرف الأكبر من آخر معرف مقروء فقط (لالتقاط ما حفظته العمليات الأخرى)
+- المؤشر (cursor) الذي يرسله العميل = وقت الرد السابق؛ الرد يحتوي فقط الموظفين الذين
+  وصل موقعهم الجديد بعده أو تغيّرت حالتهم (نشط/نشط مؤخراً/غير نشط) بمرور الوقت. كل عملية
+  ترى الموقع الجديد خلال SYNC_INTERVAL من حفظه، فيُعاد إرسال ما وصل قبل المؤشر بهذه المهلة
+  (CURSOR_SLACK) والمؤشر صالح مع أي عملية وبعد إعادة التشغيل
+- بيانات الموظفين (الاسم، الصورة، القسم) محفوظة مع المواقع وتُحدّث عند تعديل الموظفين
+  أو كل META_TTL
+- الدوائر الجغرافية منفصلة برقم إصدار (ETag من محتواها) فلا تُرسل إلا عند تغيّرها
+
+تكلفة الاستطلاع إذن تتناسب مع عدد من تحرّك، لا مع عدد الموظفين.
+"""
+import hashlib
+import json
+import logging
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import event, func, select
+from sqlalchemy.orm import Session
+
+from app import db
+
+logger = logging.getLogger(__name__)
+
+# كل كم ثانية تُقرأ المواقع الجديدة من قاعدة البيانات
+SYNC_INTERVAL = 3
+# إعادة قراءة آخر N معرفاً في كل مزامنة: معاملة بمعرف أصغر قد تُحفظ بعد معاملة بمعرف أكبر
+SYNC_OVERLAP_IDS = 200
+# ما وصل قبل المؤشر بهذه المدة يُعاد إرساله (تأخر المزامنة بين العمليات)
+CURSOR_SLACK = SYNC_INTERVAL + 2
+# إعادة تحميل بيانات الموظفين والدوائر الجغرافية احتياطياً (تغييرات العمليات الأخرى)
+META_TTL = 300
+GEOFENCES_TTL = 60
+
+# حدود حالة الموظف بالدقائق حسب عمر آخر موقع
+STATUS_LIMITS = ((5, 'active'), (30, 'recently_active'), (360, 'inactive'))
+
+_SESSION_KEY = 'live_locations_changes'
+
+_lock = threading.RLock()
+_changed = threading.Condition()
+
+_positions = {}        # معرف الموظف -> آخر موقع
+_meta = {}             # معرف الموظف -> الاسم والرقم الوظيفي والصورة والقسم
+_loaded = False
+_synced_id = 0         # آخر معرف موقع قُرئ من قاعدة البيانات
+_synced_at = 0.0
+_meta_loaded_at = 0.0
+_geofences = None      # (البيانات، الإصدار، وقت التحميل)
+
+
+def _utc(value):
+    if value is not None and value.tzinfo is not None:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def status_for(age_minutes):
+    for limit, status in STATUS_LIMITS:
+        if age_minutes < limit:
+            return status
+    return 'not_registered'
+
+
+def _position(location_id, employee_id, latitude, longitude, recorded_at, vehicle_id, speed_kmh, accuracy_m=None):
+    return {
+        'location_id': location_id,
+        'employee_id': employee_id,
+        'latitude': float(latitude),
+        'longitude': float(longitude),
+        'recorded_at': _utc(recorded_at),
+        'vehicle_id': vehicle_id,
+        'speed_kmh': float(speed_kmh) if speed_kmh is not None else None,
+        'accuracy_m': float(accuracy_m) if accuracy_m is not None else None,
+    }
+
+
+def _store(position, seen_at=None):
+    """حفظ الموقع إذا كان أحدث من المحفوظ (المواقع المتأخرة لا ترجع الخريطة للخلف)"""
+    current = _positions.get(position['employee_id'])
+    if current is not None:
+        if current['location_id'] == position['location_id']:
+            return False
+        if position['recorded_at'] is None or (current['recorded_at'] and position['recorded_at'] < current['recorded_at']):
+            return False
+    position['seen_at'] = seen_at or datetime.utcnow()
+    _positions[position['employee_id']] = position
+    return True
+
+
+def _location_columns():
+    from models import EmployeeLocation
+    return (EmployeeLocation.id, EmployeeLocation.employee_id, EmployeeLocation.latitude,
+            EmployeeLocation.longitude, EmployeeLocation.recorded_at, EmployeeLocation.vehicle_id,
+            EmployeeLocation.speed_kmh, EmployeeLocation.accuracy_m)
+
+
+def _load_all():
+    """تحميل آخر موقع لكل موظف باستعلام واحد"""
+    from models import EmployeeLocation
+    ranked = select(
+        *_location_columns(),
+        func.row_number().over(partition_by=EmployeeLocation.employee_id,
+                               order_by=(EmployeeLocation.recorded_at.desc(), EmployeeLocation.id.desc())).label('rn')
+    ).subquery()
+    rows = db.session.execute(select(ranked).where(ranked.c.rn == 1)).all()
+    max_id = db.session.execute(select(func.max(EmployeeLocation.id))).scalar() or 0
+    _positions.clear()
+    # عند التحميل (أول طلب أو بعد إعادة التشغيل) يُعتبر الموقع واصلاً وقت تسجيله، فلا يُعاد
+    # إرسال كل المواقع لمؤشرات العملاء الحالية ولا يضيع ما سُجّل قبل إعادة التشغيل بقليل
+    now = datetime.utcnow()
+    for row in rows:
+        if row.latitude is not None and row.longitude is not None:
+            position = _position(*row[:8])
+            _store(position, min(position['recorded_at'] or now, now))
+    return max_id
+
+
+def _sync_new():
+    """قراءة المواقع المحفوظة منذ آخر مزامنة فقط"""
+    from models import EmployeeLocation
+    rows = db.session.execute(
+        select(*_location_columns())
+        .where(EmployeeLocation.id > max(_synced_id - SYNC_OVERLAP_IDS, 0))
+        .order_by(EmployeeLocation.id)
+    ).all()
+    moved = 0
+    for row in rows:
+        if row.latitude is not None and row.longitude is not None:
+            moved += _store(_position(*row))
+    return (rows[-1].id if rows else _synced_id), moved
+
+
+def _load_meta(employee_ids=None):
+    """بيانات الموظفين (كلهم أو المحددين) مع أول قسم لكل موظف"""
+    from models import Department, Employee, employee_departments
+    first_department = (
+        select(func.min(employee_departments.c.department_id))
+        .where(employee_departments.c.employee_id == Employee.id)
+        .correlate(Employee).scalar_subquery()
+    )
+    query = select(Employee.id, Employee.name, Employee.employee_id, Employee.profile_image,
+                   first_department.label('department_id'))
+    if employee_ids is not None:
+        query = query.where(Employee.id.in_(employee_ids))
+    rows = db.session.execute(query).all()
+    department_ids = {row.department_id for row in rows if row.department_id}
+    names = dict(db.session.execute(
+        select(Department.id, Department.name).where(Department.id.in_(department_ids))).all()) if department_ids else {}
+    meta = {}
+    for row in rows:
+        meta[row.id] = {
+            'name': row.name,
+            'employee_id': row.employee_id,
+            'photo_url': row.profile_image,
+            'department_name': names.get(row.department_id, 'غير محدد'),
+            'department_id': row.department_id,
+        }
+    return meta
+
+
+def refresh(force=False):
+    """تحديث الذاكرة من قاعدة البيانات إذا حان وقت المزامنة"""
+    global _loaded, _synced_id, _synced_at, _meta, _meta_loaded_at
+    now = time.monotonic()
+    with _lock:
+        moved = 0
+        if not _loaded or force:
+            _synced_id = _load_all()
+            _loaded = True
+            _synced_at = now
+            moved = len(_positions)
+        elif now - _synced_at >= SYNC_INTERVAL:
+            _synced_id, moved = _sync_new()
+            _synced_at = now
+        if force or not _meta_loaded_at or now - _meta_loaded_at >= META_TTL:
+            _meta = _load_meta()
+            _meta_loaded_at = now
+        else:
+            missing = [employee_id for employee_id in _positions if employee_id not in _meta]
+            if missing:
+                _meta.update(_load_meta(missing))
+    if moved:
+        _notify()
+
+
+def _notify():
+    with _changed:
+        _changed.notify_all()
+
+
+def wait_for_change(timeout):
+    """انتظار موقع جديد من نفس العملية أو انتهاء المهلة (للبث عبر SSE)"""
+    with _changed:
+        _changed.wait(timeout)
+
+
+# ---------------------------------------------------------------------------
+# التحديث من مسار الاستقبال
+# ---------------------------------------------------------------------------
+
+def _tracked_models():
+    from models import Department, Employee, EmployeeLocation, Geofence
+    return EmployeeLocation, (Employee, Department), Geofence
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect(session, flush_context):
+    location_model, meta_models, geofence_model = _tracked_models()
+    changes = None
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, location_model):
+            if obj in session.deleted or obj.latitude is None or obj.longitude is None:
+                continue
+            changes = changes or session.info.setdefault(_SESSION_KEY, {'positions': [], 'meta': False, 'geofences': False})
+            changes['positions'].append(_position(obj.id, obj.employee_id, obj.latitude, obj.longitude,
+                                                  obj.recorded_at, obj.vehicle_id, obj.speed_kmh, obj.accuracy_m))
+        elif isinstance(obj, meta_models):
+            changes = changes or session.info.setdefault(_SESSION_KEY, {'positions': [], 'meta': False, 'geofences': False})
+            changes['meta'] = True
+        elif isinstance(obj, geofence_model):
+            changes = changes or session.info.setdefault(_SESSION_KEY, {'positions': [], 'meta': False, 'geofences': False})
+            changes['geofences'] = True
+
+
+@event.listens_for(Session, 'after_commit')
+def _on_commit(session):
+    global _meta_loaded_at, _geofences
+    changes = session.info.pop(_SESSION_KEY, None)
+    if not changes:
+        return
+    with _lock:
+        if changes['meta']:
+            _meta_loaded_at = 0.0
+        if changes['geofences']:
+            _geofences = None
+        if not _loaded:
+            return
+        moved = sum(_store(position) for position in changes['positions'])
+    if moved:
+        _notify()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _on_rollback(session):
+    session.info.pop(_SESSION_KEY, None)
+
+
+# ---------------------------------------------------------------------------
+# القراءة
+# ---------------------------------------------------------------------------
+
+def make_cursor(at):
+    return f"{at.replace(tzinfo=timezone.utc).timestamp():.3f}"
+
+
+def parse_cursor(cursor):
+    """وقت الرد السابق أو None إذا كان المؤشر غير صالح"""
+    try:
+        return datetime.utcfromtimestamp(float(cursor))
+    except (TypeError, ValueError, OverflowError, OSError):
+        return None
+
+
+def _entry(position, meta, now):
+    age_minutes = (now - position['recorded_at']).total_seconds() / 60
+    entry = {
+        'latitude': position['latitude'],
+        'longitude': position['longitude'],
+        'status': status_for(age_minutes),
+        'age_minutes': int(age_minutes),
+        'last_update': position['recorded_at'].strftime('%Y-%m-%d %H:%M:%S'),
+        'vehicle_id': position['vehicle_id'],
+        'speed_kmh': position['speed_kmh'],
+    }
+    entry.update(meta or {'name': None, 'employee_id': None, 'photo_url': None,
+                          'department_name': 'غير محدد', 'department_id': None})
+    return entry
+
+
+def latest():
+    """نسخة من {معرف الموظف: آخر موقع} وبيانات الموظفين (للصفحات التي تحتاج كل المواقع)"""
+    refresh()
+    with _lock:
+        return dict(_positions), dict(_meta)
+
+
+def feed(cursor=None):
+    """
+    المواقع للخريطة
+
+    بدون مؤشر (أو بمؤشر غير صالح): كل الموظفين، ومن لا موقع له بحالة not_registered.
+    بالمؤشر: من تحرّك بعده أو تغيّرت حالته فقط.
+
+    :return: (المواقع {معرف الموظف كنص: بيانات}، المؤشر الجديد، كامل أم تغييرات)
+    """
+    refresh()
+    now = datetime.utcnow()
+    since = parse_cursor(cursor) if cursor else None
+    locations = {}
+    with _lock:
+        if since is None:
+            for employee_id in _meta:
+                locations[str(employee_id)] = {'status': 'not_registered'}
+            for employee_id, position in _positions.items():
+                locations[str(employee_id)] = _entry(position, _meta.get(employee_id), now)
+        else:
+            floor = since - timedelta(seconds=CURSOR_SLACK)
+            for employee_id, position in _positions.items():
+                if position['seen_at'] < floor:
+                    before = status_for((since - position['recorded_at']).total_seconds() / 60)
+                    after = status_for((now - position['recorded_at']).total_seconds() / 60)
+                    if before == after:
+                        continue
+                locations[str(employee_id)] = _entry(position, _meta.get(employee_id), now)
+    return locations, make_cursor(now), since is None
+
+
+def geofences():
+    """(بيانات الدوائر الجغرافية، الإصدار) محفوظة حتى تتغير أو تنتهي GEOFENCES_TTL"""
+    global _geofences
+    with _lock:
+        if _geofences is not None and time.monotonic() - _geofences[2] < GEOFENCES_TTL:
+            return _geofences[0], _geofences[1]
+    from models import Geofence
+    data = [{
+        'id': gf.id,
+        'name': gf.name,
+        'latitude': float(gf.center_latitude),
+        'longitude': float(gf.center_longitude),
+        'radius': gf.radius_meters,
+        'color': gf.color,
+        'department_id': gf.department_id
+    } for gf in Geofence.query.order_by(Geofence.id).all()]
+    version = hashlib.sha1(json.dumps(data, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+    with _lock:
+        _geofences = (data, version, time.monotonic())
+    return data, version
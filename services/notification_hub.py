@@ -0,0 +1,349 @@
+"""
+مركز الإشعارات: عدادات غير المقروء في الذاكرة ودفع الإشعارات الجديدة
+
+بدلاً من تشغيل COUNT(*) على جدول الإشعارات في كل استطلاع من كل صفحة مفتوحة،
+يُحسب العداد مرة واحدة لكل مستخدم ثم يُحدَّث عند الإضافة والقراءة والحذف:
+- الإضافة/القراءة/الحذف عبر ORM تُلتقط تلقائياً من أحداث الجلسة (after_flush)
+  وتُطبَّق بعد نجاح commit فقط
+- التحديثات الجماعية (query.update / bulk_create / insert_many) تُسجَّل عبر record_change
+
+تعدد العمليات (gunicorn --workers): كل عملية تحتفظ بعداداتها، وعند كل تغيير يُلمس
+ملف إشارة صغير لكل مستخدم في instance/notification_signals. العملية التي تجد أن
+وقت تعديل الملف تغيّر منذ آخر قراءة تعيد العد مرة واحدة. تكلفة الاستطلاع إذن
+استدعاء stat واحد بدلاً من استعلام، والعداد يُعاد حسابه احتياطياً كل COUNTER_TTL.
+
+نفس رقم الإصدار (وقت تعديل ملف الإشارة) يُستخدم للانتظار الطويل (long-poll)
+وبث SSE: المنتظر يستيقظ فوراً عند تغيير من نفس العملية، أو خلال SIGNAL_POLL_INTERVAL
+عند تغيير من عملية أخرى، ثم يجلب الإشعارات الجديدة باستعلام واحد.
+"""
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+from sqlalchemy import event, func, insert, inspect, select
+from sqlalchemy.orm import Session
+
+from app import db
+
+logger = logging.getLogger(__name__)
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SIGNALS_DIR = os.path.join(PROJECT_ROOT, 'instance', 'notification_signals')
+
+# نوعا المستلمين: مستخدمو لوحة التحكم (Notification) والموظفون في التطبيق (RequestNotification)
+USER = 'user'
+EMPLOYEE = 'employee'
+
+# إعادة العد الاحتياطية، وعدد المستخدمين المحفوظة عداداتهم في الذاكرة
+COUNTER_TTL = 300
+MAX_COUNTERS = 10000
+
+# كم ثانية ينتظر المنتظر قبل فحص ملف الإشارة بحثاً عن تغييرات العمليات الأخرى
+SIGNAL_POLL_INTERVAL = 2.0
+
+_SESSION_KEY = 'notification_hub_changes'
+
+# (النوع، المعرف) -> (العدد، إصدار الإشارة عند الحساب، وقت الحساب)
+_counters = OrderedDict()
+_lock = threading.Lock()
+_changed = threading.Condition()
+
+
+def _models():
+    from models import Notification, RequestNotification
+    return {Notification: (USER, 'user_id'), RequestNotification: (EMPLOYEE, 'employee_id')}
+
+
+def _model_for(kind):
+    for model, (model_kind, owner_field) in _models().items():
+        if model_kind == kind:
+            return model, owner_field
+    raise ValueError(f"نوع مستلم غير معروف: {kind}")
+
+
+def _key_for(obj):
+    spec = _models().get(type(obj))
+    if spec is None:
+        return None
+    kind, owner_field = spec
+    owner_id = obj.__dict__.get(owner_field)
+    return (kind, owner_id) if owner_id is not None else None
+
+
+# ---------------------------------------------------------------------------
+# ملفات الإشارة بين العمليات
+# ---------------------------------------------------------------------------
+
+def _signal_path(key):
+    kind, owner_id = key
+    return os.path.join(SIGNALS_DIR, f"{kind}-{int(owner_id)}")
+
+
+def signal_version(kind, owner_id):
+    """رقم إصدار إشعارات المستلم (يتغير مع كل إضافة أو قراءة أو حذف)"""
+    try:
+        return os.stat(_signal_path((kind, owner_id))).st_mtime_ns
+    except OSError:
+        return 0
+
+
+def _touch(key):
+    path = _signal_path(key)
+    now = time.time_ns()
+    try:
+        try:
+            os.utime(path, ns=(now, now))
+        except FileNotFoundError:
+            os.makedirs(SIGNALS_DIR, exist_ok=True)
+            open(path, 'a').close()
+            os.utime(path, ns=(now, now))
+        return os.stat(path).st_mtime_ns
+    except OSError as e:
+        logger.warning(f"تعذر تحديث إشارة الإشعارات {path}: {e}")
+        return None
+
+
+# ---------------------------------------------------------------------------
+# العدادات
+# ---------------------------------------------------------------------------
+
+def _count_from_db(key):
+    """
+    العد من البيانات المحفوظة فقط، باتصال مستقل عن جلسة الطلب
+
+    إشعارات الجلسة غير المحفوظة تُضاف للعداد بعد commit؛ عدّها هنا أيضاً يحسبها مرتين.
+    """
+    kind, owner_id = key
+    model, owner_field = _model_for(kind)
+    query = select(func.count()).select_from(model).where(
+        getattr(model, owner_field) == owner_id,
+        model.is_read.is_(False)
+    )
+    with db.engine.connect() as connection:
+        return connection.execute(query).scalar()
+
+
+def unread_count(kind, owner_id):
+    """عدد الإشعارات غير المقروءة للمستلم من الذاكرة (استعلام واحد عند أول طلب أو بعد تغيير خارجي)"""
+    if owner_id is None:
+        return 0
+    key = (kind, owner_id)
+    version = signal_version(kind, owner_id)
+    now = time.monotonic()
+    with _lock:
+        entry = _counters.get(key)
+        if entry and entry[1] == version and now - entry[2] < COUNTER_TTL:
+            _counters.move_to_end(key)
+            return entry[0]
+
+    count = _count_from_db(key)
+    with _lock:
+        _counters[key] = (count, version, now)
+        _counters.move_to_end(key)
+        while len(_counters) > MAX_COUNTERS:
+            _counters.popitem(last=False)
+    return count
+
+
+def invalidate(kind=None, owner_id=None):
+    """إسقاط عداد مستلم (أو كل العدادات) لإعادة حسابه في الطلب التالي"""
+    with _lock:
+        if kind is None:
+            _counters.clear()
+        else:
+            _counters.pop((kind, owner_id), None)
+
+
+def _apply_changes(changes):
+    """تطبيق التغييرات بعد commit ناجح وإيقاظ المنتظرين"""
+    for key, delta in changes.items():
+        previous_version = signal_version(*key)
+        new_version = _touch(key)
+        with _lock:
+            entry = _counters.get(key)
+            if entry is None:
+                continue
+            if delta is None or new_version is None or entry[1] != previous_version:
+                # تغيير غير محدد، أو عملية أخرى غيّرت العداد منذ حسابه: يُعاد العد لاحقاً
+                del _counters[key]
+            else:
+                _counters[key] = (max(entry[0] + delta, 0), new_version, entry[2])
+    if changes:
+        with _changed:
+            _changed.notify_all()
+
+
+def record_change(kind, owner_id, delta=None, session=None):
+    """
+    تسجيل تغيير في عدد غير المقروء يُطبق عند commit الجلسة
+    (للتحديثات الجماعية التي لا تمر بأحداث ORM مثل query.update)
+
+    :param delta: مقدار التغيير، أو None إذا كان غير معروف (يُعاد العد)
+    """
+    if owner_id is None:
+        return
+    changes = (session or db.session).info.setdefault(_SESSION_KEY, {})
+    key = (kind, owner_id)
+    if key in changes and (changes[key] is None or delta is None):
+        changes[key] = None
+    else:
+        changes[key] = changes.get(key, 0) + delta
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_changes(session, flush_context):
+    for obj in session.new:
+        key = _key_for(obj)
+        if key and not obj.__dict__.get('is_read'):
+            record_change(*key, 1, session=session)
+
+    for obj in session.deleted:
+        key = _key_for(obj)
+        if key is None:
+            continue
+        was_read = obj.__dict__.get('is_read')
+        record_change(*key, None if 'is_read' not in obj.__dict__ else (0 if was_read else -1),
+                      session=session)
+
+    for obj in session.dirty:
+        key = _key_for(obj)
+        if key is None:
+            continue
+        history = inspect(obj).attrs.is_read.history
+        if not history.added:
+            continue
+        if not history.deleted:
+            record_change(*key, None, session=session)
+            continue
+        before, after = bool(history.deleted[0]), bool(history.added[0])
+        if before != after:
+            record_change(*key, -1 if after else 1, session=session)
+
+
+@event.listens_for(Session, 'after_commit')
+def _on_commit(session):
+    changes = session.info.pop(_SESSION_KEY, None)
+    if changes:
+        try:
+            _apply_changes(changes)
+        except Exception as e:
+            logger.error(f"خطأ في تحديث عدادات الإشعارات: {e}")
+            invalidate()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _on_rollback(session):
+    session.info.pop(_SESSION_KEY, None)
+
+
+# ---------------------------------------------------------------------------
+# الإنشاء الجماعي
+# ---------------------------------------------------------------------------
+
+def bulk_create(user_ids, notification_type, title, description=None,
+                related_entity_type=None, related_entity_id=None,
+                priority='normal', action_url=None):
+    """
+    إنشاء نفس الإشعار لعدة مستخدمين بعبارة INSERT واحدة (executemany)
+
+    الحفظ مسؤولية المستدعي (db.session.commit)، والعدادات تُحدَّث بعده.
+
+    :return: عدد الإشعارات المنشأة
+    """
+    user_ids = [user_id for user_id in dict.fromkeys(user_ids) if user_id is not None]
+    if not user_ids:
+        return 0
+
+    now = datetime.utcnow()
+    rows = [{
+        'user_id': user_id,
+        'notification_type': notification_type,
+        'title': title,
+        'description': description,
+        'related_entity_type': related_entity_type,
+        'related_entity_id': related_entity_id,
+        'priority': priority or 'normal',
+        'action_url': action_url,
+        'is_read': False,
+        'created_at': now,
+    } for user_id in user_ids]
+    return insert_many(rows)
+
+
+def insert_many(rows):
+    """
+    إدراج إشعارات مختلفة (صفوف Notification جاهزة) بعبارة INSERT واحدة
+
+    الحفظ مسؤولية المستدعي (db.session.commit)، والعدادات تُحدَّث بعده.
+
+    :return: عدد الإشعارات المنشأة
+    """
+    from models import Notification
+
+    if not rows:
+        return 0
+    db.session.execute(insert(Notification), rows)
+
+    per_user = {}
+    for row in rows:
+        if not row.get('is_read'):
+            per_user[row['user_id']] = per_user.get(row['user_id'], 0) + 1
+    for user_id, count in per_user.items():
+        record_change(USER, user_id, count)
+    return len(rows)
+
+
+# ---------------------------------------------------------------------------
+# الانتظار والجلب للبث
+# ---------------------------------------------------------------------------
+
+def wait_for_change(kind, owner_id, since_version, timeout):
+    """
+    الانتظار حتى يتغير إصدار إشعارات المستلم أو تنتهي المهلة
+
+    :return: الإصدار الحالي (يساوي since_version عند انتهاء المهلة دون تغيير)
+    """
+    deadline = time.monotonic() + timeout
+    version = signal_version(kind, owner_id)
+    while version == since_version:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        with _changed:
+            _changed.wait(min(remaining, SIGNAL_POLL_INTERVAL))
+        version = signal_version(kind, owner_id)
+    return version
+
+
+def serialize_notification(notification):
+    return {
+        'id': notification.id,
+        'type': notification.notification_type,
+        'title': notification.title,
+        'description': notification.description,
+        'priority': notification.priority,
+        'action_url': notification.action_url,
+        'is_read': bool(notification.is_read),
+        'created_at': notification.created_at.isoformat() if notification.created_at else None,
+    }
+
+
+def notifications_after(user_id, last_id, limit=20):
+    """الإشعارات الأحدث من last_id للمستخدم (مرتبة تصاعدياً)"""
+    from models import Notification
+
+    return Notification.query.filter(
+        Notification.user_id == user_id,
+        Notification.id > (last_id or 0)
+    ).order_by(Notification.id.asc()).limit(limit).all()
+
+
+def latest_notification_id(user_id):
+    from models import Notification
+
+    return db.session.query(db.func.max(Notification.id)).filter(
+        Notification.user_id == user_id
+    ).scalar() or 0
@@ -0,0 +1,638 @@
+"""
+خدمة تصدير لوحة Power BI إلى Excel
+
+- جلب أقسام البيانات (نظرة عامة، الحضور، الوثائق، السيارات) بالتوازي،
+  كل قسم في سياق تطبيق مستقل وبالتالي على اتصال قاعدة بيانات منفصل
+- بناء الملف بوضع write-only (ذاكرة ثابتة) مع أنماط مسماة مشتركة
+- تخزين الملفات الناتجة مؤقتاً حسب (النوع، الفترة، القسم)
+"""
+import hashlib
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from flask import current_app
+from openpyxl import Workbook
+from openpyxl.chart import BarChart, PieChart, DoughnutChart, Reference
+from openpyxl.chart.label import DataLabelList
+from openpyxl.utils import get_column_letter
+from sqlalchemy import func, case, distinct, exists
+
+from app import db
+from models import Employee, Attendance, Document, Vehicle, Department, VehicleHandover, employee_departments
+from utils.excel_styles import use_style_sheet, styled_cell
+
+logger = logging.getLogger(__name__)
+
+# مدة صلاحية الملف المخزن مؤقتاً (بالثواني)
+EXPORT_CACHE_TTL = int(os.environ.get('POWERBI_EXPORT_CACHE_TTL', 15 * 60))
+
+# الحد الأقصى لسجلات الحضور في الورقة التفصيلية
+ATTENDANCE_DETAIL_LIMIT = 500
+
+# عدد الأعمدة في ورقة اللوحة الرئيسية والصفوف ذات الخلفية الداكنة
+DASHBOARD_COLUMNS = 21
+DASHBOARD_MIN_ROWS = 69
+
+_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='powerbi-export')
+_build_locks = {}
+_build_locks_guard = threading.Lock()
+
+ATTENDANCE_STATUS_AR = {
+    'present': 'حاضر',
+    'absent': 'غائب',
+    'late': 'متأخر',
+    'excused': 'معذور',
+    'leave': 'إجازة',
+    'sick': 'مريض'
+}
+
+VEHICLE_STATUS_AR = {
+    'working': 'نشط',
+    'maintenance': 'صيانة',
+    'inactive': 'غير نشط'
+}
+
+
+# ==================== جلب البيانات ====================
+
+def _in_app_context(app, func_, *args):
+    """تشغيل دالة الجلب في سياق تطبيق مستقل (جلسة واتصال منفصلان)"""
+    with app.app_context():
+        try:
+            return func_(*args)
+        finally:
+            db.session.remove()
+
+
+def _active_employees_filter(query, department_id):
+    """تصفية الموظفين النشطين مع القسم (اختياري)"""
+    query = query.filter(Employee.status == 'active')
+    if department_id:
+        query = query.filter(Employee.departments.any(Department.id == department_id))
+    return query
+
+
+def _department_names_map(employee_ids=None):
+    """خريطة معرف الموظف -> اسم أول قسم (بديل employee.department بدون تحميل كسول)"""
+    query = db.session.query(
+        employee_departments.c.employee_id, Department.name
+    ).join(Department, Department.id == employee_departments.c.department_id)
+    if employee_ids is not None:
+        if not employee_ids:
+            return {}
+        query = query.filter(employee_departments.c.employee_id.in_(employee_ids))
+
+    names = {}
+    for emp_id, dept_name in query.order_by(employee_departments.c.department_id):
+        names.setdefault(emp_id, dept_name)
+    return names
+
+
+def fetch_overview_section():
+    """إحصائيات عامة: السيارات حسب الحالة والوثائق والأقسام"""
+    status_counts = dict(
+        db.session.query(Vehicle.status, func.count(Vehicle.id)).group_by(Vehicle.status).all()
+    )
+    return {
+        'total_vehicles': sum(status_counts.values()),
+        'vehicle_status': status_counts,
+        'total_documents': db.session.query(func.count(Document.id)).scalar() or 0,
+        'total_departments': db.session.query(func.count(Department.id)).scalar() or 0,
+    }
+
+
+def fetch_attendance_section(d_from, d_to, department_id=None, with_details=False):
+    """إحصائيات الحضور للموظفين النشطين بالفترة مجمعة في قاعدة البيانات"""
+    in_period = (Attendance.date >= d_from, Attendance.date <= d_to)
+
+    base = _active_employees_filter(
+        db.session.query(Attendance).join(Employee, Employee.id == Attendance.employee_id),
+        department_id
+    ).filter(*in_period)
+
+    # عدد الموظفين النشطين الذين لهم حضور + توزيع الحالات
+    total_employees = base.with_entities(func.count(distinct(Attendance.employee_id))).scalar() or 0
+    status_counts = dict(base.with_entities(Attendance.status, func.count(Attendance.id))
+                         .group_by(Attendance.status).all())
+
+    # إحصائيات الأقسام في استعلام واحد بدلاً من حلقة لكل قسم
+    dept_rows = base.join(
+        employee_departments, employee_departments.c.employee_id == Employee.id
+    ).join(
+        Department, Department.id == employee_departments.c.department_id
+    ).with_entities(
+        Department.id,
+        Department.name,
+        func.count(distinct(Attendance.employee_id)),
+        func.sum(case((Attendance.status == 'present', 1), else_=0)),
+        func.sum(case((Attendance.status == 'absent', 1), else_=0)),
+        func.sum(case((Attendance.status == 'late', 1), else_=0)),
+        func.count(Attendance.id),
+    ).group_by(Department.id, Department.name).order_by(Department.id).all()
+
+    departments = [{
+        'id': dept_id,
+        'name': name,
+        'employees': employees or 0,
+        'present': int(present or 0),
+        'absent': int(absent or 0),
+        'late': int(late or 0),
+        'total': total or 0,
+    } for dept_id, name, employees, present, absent, late, total in dept_rows]
+
+    section = {
+        'total_employees': total_employees,
+        'status_counts': {
+            'present': status_counts.get('present', 0),
+            'absent': status_counts.get('absent', 0) + status_counts.get('غائب', 0),
+            'leave': status_counts.get('leave', 0),
+            'sick': status_counts.get('sick', 0),
+        },
+        'departments': departments,
+        'department_headcount': dict(
+            db.session.query(employee_departments.c.department_id, func.count(employee_departments.c.employee_id))
+            .group_by(employee_departments.c.department_id).all()
+        ),
+        'records': [],
+    }
+
+    if with_details:
+        rows = base.with_entities(
+            Attendance.date, Attendance.status, Attendance.check_in, Attendance.check_out,
+            Employee.id, Employee.name, Employee.employee_id
+        ).order_by(Attendance.date.desc()).limit(ATTENDANCE_DETAIL_LIMIT).all()
+        dept_names = _department_names_map({r[4] for r in rows})
+        section['records'] = [
+            (att_date, status, check_in, check_out, name, emp_number, dept_names.get(emp_id, ''))
+            for att_date, status, check_in, check_out, emp_id, name, emp_number in rows
+        ]
+
+    return section
+
+
+def fetch_documents_section(department_id=None, with_details=False):
+    """عدد الوثائق لكل موظف واكتمالها"""
+    doc_counts = db.session.query(Document.employee_id, func.count(Document.id))
+    employees = db.session.query(Employee.id, Employee.name, Employee.employee_id)
+    if department_id:
+        in_department = Employee.departments.any(Department.id == department_id)
+        doc_counts = doc_counts.join(Employee, Employee.id == Document.employee_id).filter(in_department)
+        employees = employees.filter(in_department)
+
+    doc_count_map = dict(doc_counts.group_by(Document.employee_id).all())
+    section = {
+        'complete_employees': sum(1 for cnt in doc_count_map.values() if cnt >= 4),
+        'employees': [],
+    }
+
+    if with_details:
+        dept_names = _department_names_map()
+        section['employees'] = [
+            (emp_id, name, emp_number, dept_names.get(emp_id), doc_count_map.get(emp_id, 0))
+            for emp_id, name, emp_number in employees.order_by(Employee.id)
+        ]
+
+    return section
+
+
+def fetch_vehicles_section():
+    """بيانات السيارات مع حالة التسليم (استعلام واحد بدون تحميل سجلات التسليم)"""
+    has_handover = exists().where(VehicleHandover.vehicle_id == Vehicle.id)
+    return db.session.query(
+        Vehicle.plate_number, Vehicle.make, Vehicle.model, Vehicle.year, Vehicle.status, has_handover
+    ).order_by(Vehicle.id).all()
+
+
+def fetch_export_data(app, data_type, d_from, d_to, department_id=None):
+    """جلب جميع أقسام التقرير بالتوازي"""
+    futures = {
+        'overview': _executor.submit(_in_app_context, app, fetch_overview_section),
+        'attendance': _executor.submit(
+            _in_app_context, app, fetch_attendance_section, d_from, d_to, department_id,
+            data_type in ('attendance', 'all')
+        ),
+        'documents': _executor.submit(
+            _in_app_context, app, fetch_documents_section, department_id, data_type in ('employees', 'all')
+        ),
+    }
+    if data_type in ('vehicles', 'all'):
+        futures['vehicles'] = _executor.submit(_in_app_context, app, fetch_vehicles_section)
+
+    return {name: future.result() for name, future in futures.items()}
+
+
+# ==================== بناء الملف ====================
+
+class _DashboardGrid:
+    """
+    شبكة خلايا لورقة اللوحة الرئيسية
+
+    ورقة write-only تُكتب صفاً بصف، لذلك تُجمع خلايا اللوحة (بضع مئات فقط)
+    ثم تُكتب دفعة واحدة مع تعبئة الخلايا الفارغة بالخلفية الداكنة.
+    """
+
+    def __init__(self, columns, background_style):
+        self.columns = columns
+        self.background_style = background_style
+        self.cells = {}
+        self.heights = {}
+        self.merges = []
+
+    def set(self, row, col, value=None, style=None):
+        self.cells[(row, col)] = (value, style)
+
+    def fill(self, row, style, start_col=1, end_col=None):
+        for col in range(start_col, (end_col or self.columns) + 1):
+            self.set(row, col, None, style)
+
+    def merge(self, row, start_col, end_col, value, style):
+        self.fill(row, style, start_col, end_col)
+        self.cells[(row, start_col)] = (value, style)
+        self.merges.append(f"{get_column_letter(start_col)}{row}:{get_column_letter(end_col)}{row}")
+
+    def height(self, row, value):
+        self.heights[row] = value
+
+    def write(self, ws, min_rows=0):
+        for row, value in self.heights.items():
+            ws.row_dimensions[row].height = value
+        for cell_range in self.merges:
+            ws.merged_cells.add(cell_range)
+
+        last_row = max([min_rows] + [row for row, _ in self.cells])
+        for row in range(1, last_row + 1):
+            ws.append([
+                styled_cell(ws, *self.cells.get((row, col), (None, self.background_style)))
+                for col in range(1, self.columns + 1)
+            ])
+
+
+def _percent(count, total):
+    return round((count / total * 100), 1) if total > 0 else 0
+
+
+def _bar(pct):
+    return "█" * (int(pct / 4) if pct > 0 else 1)
+
+
+def _rating(rate):
+    """التقييم ولون التمييز حسب نسبة الحضور"""
+    if rate >= 90:
+        return "ممتاز ⭐", 'green', 'success'
+    if rate >= 75:
+        return "جيد 👍", 'teal', 'info'
+    if rate >= 60:
+        return "متوسط ⚡", 'orange', 'warning'
+    return "يحتاج تحسين ⚠️", 'red', 'danger'
+
+
+def _write_stat_table(grid, start_row, title, headers, rows, title_end_col=5):
+    """جدول إحصائي (الحالة، العدد، النسبة، الرسم) داخل اللوحة"""
+    grid.merge(start_row, 1, title_end_col, title, 'pbi_section')
+    grid.height(start_row, 35)
+    for col, header in enumerate(headers, start=1):
+        grid.set(start_row + 1, col, header, 'pbi_table_header')
+    grid.height(start_row + 1, 28)
+
+    row = start_row + 2
+    for label, count, pct, bar_color, pct_style in rows:
+        grid.set(row, 1, label, 'pbi_row_label')
+        grid.set(row, 2, count, 'pbi_row_count')
+        grid.set(row, 3, f"{pct}%", pct_style)
+        grid.set(row, 4, _bar(pct), f'pbi_bar_{bar_color}')
+        grid.height(row, 26)
+        row += 1
+    return row - 1
+
+
+def _pie(chart_cls, ws, title, header_row, first_row, last_row, show_cat_name=False):
+    chart = chart_cls()
+    chart.title = title
+    chart.add_data(Reference(ws, min_col=2, min_row=header_row, max_row=last_row), titles_from_data=True)
+    chart.set_categories(Reference(ws, min_col=1, min_row=first_row, max_row=last_row))
+    chart.width = 10
+    chart.height = 7
+    chart.dataLabels = DataLabelList()
+    chart.dataLabels.showPercent = True
+    if show_cat_name:
+        chart.dataLabels.showCatName = True
+    return chart
+
+
+def _build_dashboard_sheet(wb, data, d_from, d_to):
+    """ورقة اللوحة الرئيسية (KPI + الحضور + الأسطول + الأقسام + الوثائق)"""
+    overview = data['overview']
+    attendance = data['attendance']
+    vehicle_status = overview['vehicle_status']
+    total_employees = attendance['total_employees']
+    total_vehicles = overview['total_vehicles']
+
+    ws = wb.create_sheet("Power BI Dashboard")
+    ws.sheet_view.rightToLeft = True
+    column_widths = [18, 16] + [14] * 2 + [16] + [14] * 16
+    for i, width in enumerate(column_widths, 1):
+        ws.column_dimensions[get_column_letter(i)].width = width
+
+    grid = _DashboardGrid(DASHBOARD_COLUMNS, 'pbi_bg')
+    charts = []
+
+    # === الترويسة ===
+    grid.merge(1, 1, DASHBOARD_COLUMNS, "لوحة التحليلات الاحترافية | Power BI Dashboard", 'pbi_title')
+    grid.height(1, 55)
+    grid.fill(2, 'pbi_accent_cyan')
+    grid.height(2, 4)
+    grid.merge(3, 1, DASHBOARD_COLUMNS,
+               f"تاريخ التقرير: {datetime.now().strftime('%Y-%m-%d %H:%M')}   |   الفترة: {d_from} إلى {d_to}   |   نُـظـم - نظام إدارة الموظفين",
+               'pbi_subtitle')
+    grid.height(3, 30)
+    grid.merge(4, 1, DASHBOARD_COLUMNS,
+               "البيانات تعكس الموظفين النشطين فقط الذين لديهم سجلات حضور في الفترة المحددة", 'pbi_note')
+    grid.height(4, 22)
+
+    # === بطاقات KPI ===
+    kpi_data = [
+        ("الموظفين النشطين", total_employees, "👥", 1, 'cyan'),
+        ("إجمالي السيارات", total_vehicles, "🚗", 5, 'teal'),
+        ("في المشاريع", vehicle_status.get('in_project', 0), "✅", 9, 'green'),
+        ("الأقسام", overview['total_departments'], "🏢", 13, 'purple'),
+        ("الوثائق", overview['total_documents'], "📄", 17, 'orange'),
+    ]
+    for row, height in ((5, 8), (6, 30), (7, 45), (8, 8)):
+        grid.height(row, height)
+    for label, value, icon, col, accent in kpi_data:
+        grid.fill(5, f'pbi_accent_{accent}', col, col + 3)
+        grid.merge(6, col, col + 3, f"{icon}  {label}", 'pbi_kpi_label')
+        grid.merge(7, col, col + 3, value, 'pbi_kpi_value')
+        grid.fill(8, 'pbi_card_alt', col, col + 3)
+
+    # === الحضور ===
+    att = attendance['status_counts']
+    total_attendance = sum(att.values())
+    att_rows = [
+        ('حاضر ✅', att['present'], "10B981"),
+        ('غائب ❌', att['absent'], "FF4757"),
+        ('إجازة 📋', att['leave'], "3B82F6"),
+        ('مريض 🏥', att['sick'], "FFD700"),
+    ]
+    att_end = _write_stat_table(
+        grid, 10, "📊 توزيع حالات الحضور - الموظفين النشطين", ['الحالة', 'العدد', 'النسبة', 'الرسم البياني'],
+        [(label, count, _percent(count, total_attendance), color, 'pbi_row_pct') for label, count, color in att_rows],
+        title_end_col=9
+    )
+    charts.append((_pie(PieChart, ws, "توزيع الحضور", 11, 12, att_end, show_cat_name=True), "F11"))
+
+    # === الأسطول ===
+    veh_start_row = 24
+    veh_rows = [
+        ('في المشروع 🟢', vehicle_status.get('in_project', 0), "10B981"),
+        ('في الورشة 🟡', vehicle_status.get('in_workshop', 0), "FFD700"),
+        ('خارج الخدمة 🔴', vehicle_status.get('out_of_service', 0), "FF4757"),
+        ('حادث ⚠️', vehicle_status.get('accident', 0), "7B68EE"),
+    ]
+    veh_end_row = _write_stat_table(
+        grid, veh_start_row, "🚗 حالة أسطول السيارات", ['الحالة', 'العدد', 'النسبة', 'الرسم'],
+        [(label, count, _percent(count, total_vehicles), color, 'pbi_row_pct') for label, count, color in veh_rows]
+    )
+    charts.append((_pie(DoughnutChart, ws, "حالة الأسطول", veh_start_row + 1, veh_start_row + 2, veh_end_row),
+                   f"F{veh_start_row}"))
+
+    # === الأقسام ===
+    dept_start_row = veh_end_row + 10
+    grid.merge(dept_start_row, 1, 5, "🏢 نسبة الحضور حسب القسم - الموظفين النشطين", 'pbi_section')
+    grid.height(dept_start_row, 35)
+    for col, header in enumerate(['القسم', 'الموظفين', 'الحضور', 'النسبة', 'التقييم'], start=1):
+        grid.set(dept_start_row + 1, col, header, 'pbi_table_header')
+    grid.height(dept_start_row + 1, 28)
+
+    dept_row = dept_start_row + 2
+    for dept in attendance['departments'][:10]:
+        rate = round((dept['present'] / dept['total']) * 100) if dept['total'] > 0 else 0
+        rating, accent, _ = _rating(rate)
+        grid.set(dept_row, 1, dept['name'], 'pbi_row_text')
+        grid.set(dept_row, 2, dept['employees'], 'pbi_row_number')
+        grid.set(dept_row, 3, dept['present'], 'pbi_row_pct')
+        grid.set(dept_row, 4, f"{rate}%", 'pbi_row_rate')
+        grid.set(dept_row, 5, rating, f'pbi_rating_{accent}')
+        grid.height(dept_row, 26)
+        dept_row += 1
+
+    if dept_row > dept_start_row + 2:
+        bar = BarChart()
+        bar.type = "col"
+        bar.style = 12
+        bar.title = "نسبة الحضور بالأقسام"
+        bar.y_axis.title = "النسبة %"
+        bar.add_data(Reference(ws, min_col=4, min_row=dept_start_row + 1, max_row=dept_row - 1), titles_from_data=True)
+        bar.set_categories(Reference(ws, min_col=1, min_row=dept_start_row + 2, max_row=dept_row - 1))
+        bar.width = 10
+        bar.height = 7
+        bar.dataLabels = DataLabelList()
+        bar.dataLabels.showVal = True
+        charts.append((bar, f"G{dept_start_row}"))
+
+    # === الوثائق ===
+    complete_docs = data['documents']['complete_employees']
+    incomplete_docs = max(0, total_employees - complete_docs)
+    doc_start = dept_row + 10
+    doc_end = _write_stat_table(
+        grid, doc_start, "📄 حالة اكتمال الوثائق - الموظفين النشطين", ['الحالة', 'العدد', 'النسبة', 'الرسم البياني'],
+        [
+            ("مكتمل ✅", complete_docs, _percent(complete_docs, total_employees), "10B981", 'pbi_row_pct'),
+            ("ناقص ⚠️", incomplete_docs, _percent(incomplete_docs, total_employees), "FF4757", 'pbi_row_pct_warn'),
+        ]
+    )
+    charts.append((_pie(PieChart, ws, "اكتمال الوثائق", doc_start + 1, doc_start + 2, doc_end), f"G{doc_start}"))
+
+    for chart, anchor in charts:
+        ws.add_chart(chart, anchor)
+    grid.write(ws, min_rows=DASHBOARD_MIN_ROWS)
+
+
+def _detail_sheet(wb, title, heading, headers, widths, subtitle=None, header_style='pbi_detail_header_dark'):
+    """إنشاء ورقة تفصيلية مع العنوان وصف الترويسة، وإرجاعها لكتابة الصفوف"""
+    ws = wb.create_sheet(title)
+    ws.sheet_view.rightToLeft = True
+    for col, width in enumerate(widths, start=1):
+        ws.column_dimensions[get_column_letter(col)].width = width
+
+    last_col = get_column_letter(len(headers))
+    ws.merged_cells.add(f"A1:{last_col}1")
+    ws.row_dimensions[1].height = 30
+    ws.append([styled_cell(ws, heading, 'pbi_detail_title')])
+
+    if subtitle:
+        ws.merged_cells.add(f"A2:{last_col}2")
+        ws.append([styled_cell(ws, subtitle, 'pbi_detail_subtitle')])
+    ws.append([])
+    header_row = 4 if subtitle else 3
+
+    ws.row_dimensions[header_row].height = 25
+    ws.append([styled_cell(ws, header, header_style) for header in headers])
+    return ws, header_row + 1
+
+
+def _append_detail_row(ws, row_idx, values, highlight_col, highlight):
+    """صف تفصيلي بتلوين متبادل وتمييز عمود الحالة"""
+    base_style = 'pbi_detail_alt' if row_idx % 2 == 0 else 'pbi_detail_cell'
+
+    def style_for(col):
+        if col != highlight_col:
+            return base_style
+        return f'pbi_detail_{highlight}' if highlight else 'pbi_detail_cell'
+
+    ws.append([styled_cell(ws, value, style_for(col)) for col, value in enumerate(values, start=1)])
+
+
+def _build_attendance_sheet(wb, records, d_from, d_to):
+    ws, row_idx = _detail_sheet(
+        wb, "تقرير الحضور", "📋 تقرير الحضور التفصيلي - الموظفين النشطين",
+        ['التاريخ', 'اسم الموظف', 'الرقم الوظيفي', 'القسم', 'الحالة', 'وقت الحضور', 'وقت الانصراف'],
+        [18] * 7, subtitle=f"الفترة: {d_from} إلى {d_to}", header_style='pbi_detail_header'
+    )
+    highlights = {'present': 'success', 'absent': 'danger', 'late': 'warning', 'excused': 'info'}
+    for att_date, status, check_in, check_out, name, emp_number, dept_name in records:
+        status = status or 'unknown'
+        _append_detail_row(ws, row_idx, [
+            att_date.strftime('%Y-%m-%d') if att_date else '',
+            name or 'غير معروف',
+            emp_number or '',
+            dept_name,
+            ATTENDANCE_STATUS_AR.get(status, status),
+            check_in.strftime('%H:%M') if check_in else '',
+            check_out.strftime('%H:%M') if check_out else '',
+        ], 5, highlights.get(status))
+        row_idx += 1
+
+
+def _build_employees_sheet(wb, employees):
+    ws, row_idx = _detail_sheet(
+        wb, "تقرير الموظفين", "👥 تقرير الموظفين والوثائق",
+        ['الرقم', 'اسم الموظف', 'الرقم الوظيفي', 'القسم', 'عدد الوثائق', 'حالة الوثائق'], [18] * 6
+    )
+    for emp_id, name, emp_number, dept_name, docs_count in employees:
+        complete = docs_count >= 4
+        _append_detail_row(ws, row_idx, [
+            emp_id, name, emp_number or '-', dept_name or 'بدون قسم', docs_count,
+            'مكتمل ✅' if complete else 'ناقص ⚠️'
+        ], 6, 'success' if complete else 'warning')
+        row_idx += 1
+
+
+def _build_vehicles_sheet(wb, vehicles):
+    ws, row_idx = _detail_sheet(
+        wb, "تقرير السيارات", "🚗 تقرير أسطول السيارات",
+        ['رقم اللوحة', 'الماركة', 'الموديل', 'السنة', 'الحالة', 'حالة التسليم'], [16] * 6
+    )
+    highlights = {'working': 'success', 'maintenance': 'warning', 'inactive': 'danger'}
+    for plate_number, make, model, year, status, has_handover in vehicles:
+        status = status or 'unknown'
+        _append_detail_row(ws, row_idx, [
+            plate_number or '', make or '', model or '', year or '',
+            VEHICLE_STATUS_AR.get(status, status),
+            'مستلمة ✅' if has_handover else 'غير مستلمة'
+        ], 5, highlights.get(status))
+        row_idx += 1
+
+
+def _build_departments_sheet(wb, attendance):
+    ws, row_idx = _detail_sheet(
+        wb, "تحليل الأقسام", "🏢 تحليل الحضور حسب الأقسام",
+        ['القسم', 'عدد الموظفين', 'حاضر', 'غائب', 'متأخر', 'نسبة الحضور', 'التقييم'], [16] * 7
+    )
+    headcount = attendance['department_headcount']
+    for dept in attendance['departments']:
+        rate = round((dept['present'] / dept['total']) * 100, 1) if dept['total'] > 0 else 0
+        performance, _, highlight = _rating(rate)
+        _append_detail_row(ws, row_idx, [
+            dept['name'], headcount.get(dept['id'], dept['employees']), dept['present'],
+            dept['absent'], dept['late'], f'{rate}%', performance
+        ], 7, highlight)
+        row_idx += 1
+
+
+def build_workbook(data, data_type, d_from, d_to, output):
+    """بناء ملف Excel بوضع write-only من البيانات المجمعة مسبقاً"""
+    wb = Workbook(write_only=True)
+    use_style_sheet(wb, 'powerbi')
+
+    _build_dashboard_sheet(wb, data, d_from, d_to)
+    if data_type in ('attendance', 'all'):
+        _build_attendance_sheet(wb, data['attendance']['records'], d_from, d_to)
+    if data_type in ('employees', 'all'):
+        _build_employees_sheet(wb, data['documents']['employees'])
+    if data_type in ('vehicles', 'all'):
+        _build_vehicles_sheet(wb, data['vehicles'])
+    if data_type == 'all':
+        _build_departments_sheet(wb, data['attendance'])
+
+    wb.save(output)
+
+
+# ==================== التخزين المؤقت ====================
+
+def _cache_dir():
+    path = os.path.join(current_app.instance_path, 'powerbi_exports')
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def _cache_key(data_type, d_from, d_to, department_id):
+    raw = f"{data_type}|{d_from}|{d_to}|{department_id or ''}"
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+
+def _is_fresh(path):
+    return os.path.exists(path) and (time.time() - os.path.getmtime(path)) < EXPORT_CACHE_TTL
+
+
+def _lock_for(key):
+    with _build_locks_guard:
+        return _build_locks.setdefault(key, threading.Lock())
+
+
+def get_export_file(data_type, d_from, d_to, department_id=None):
+    """
+    إرجاع مسار ملف التصدير، مع إعادة استخدام نسخة حديثة إن وجدت
+
+    يُبنى الملف مرة واحدة لكل مفتاح حتى مع الطلبات المتزامنة؛ الطلبات
+    الأخرى تنتظر ثم تقرأ نفس الملف.
+    """
+    key = _cache_key(data_type, d_from, d_to, department_id)
+    path = os.path.join(_cache_dir(), f"{key}.xlsx")
+
+    if _is_fresh(path):
+        return path
+
+    with _lock_for(key):
+        if _is_fresh(path):
+            return path
+
+        started = time.perf_counter()
+        app = current_app._get_current_object()
+        data = fetch_export_data(app, data_type, d_from, d_to, department_id)
+
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            build_workbook(data, data_type, d_from, d_to, tmp_path)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+        logger.info(f"Power BI export built ({data_type}, {d_from}..{d_to}) in {time.perf_counter() - started:.2f}s")
+        return path
+
+
+def clear_export_cache():
+    """حذف جميع ملفات التصدير المخزنة مؤقتاً"""
+    cache_dir = _cache_dir()
+    removed = 0
+    for name in os.listdir(cache_dir):
+        if name.endswith('.xlsx'):
+            os.remove(os.path.join(cache_dir, name))
+            removed += 1
+    return removed
@@ -0,0 +1,262 @@
+"""
+تحميل التطبيق مسبقاً في عملية gunicorn الرئيسية (preload) بشكل صديق لـ copy-on-write
+
+بدون التحميل المسبق يستورد كل عامل التطبيق بنفسه: ينشئ عميل واتساب، ويبني بيانات
+SQLAlchemy الوصفية، ويستدعي db.create_all()، ثم يحلل القوالب والخطوط عند أول استخدام،
+فتتكرر هذه الذاكرة في كل عامل. مع PRELOAD_APP=1 (انظر gunicorn.conf.py):
+
+- العملية الرئيسية تستورد التطبيق مرة واحدة (create_all مرة واحدة) ثم warm():
+  تترجم كل قوالب Jinja، وتسجل الخطوط المشتركة (utils.pdf.SHARED_FONTS)، وتستورد مكتبات
+  التقارير المؤجلة (PRELOAD_MODULES)، وتبني جداول البحث الثابتة التي تُبنى عادة عند أول
+  طلب (علاقات المخططات، مطابق المسارات، أنواع الملفات، جداول النسخ الاحتياطي) فتُشارك
+  صفحاتها بين العمال بدل بنائها في كل عامل. الذاكرات المبنية من قاعدة البيانات (مثل
+  المناطق الجغرافية) لا تُبنى هنا: تتقادم في العملية الرئيسية ولكل عامل مدة صلاحيتها
+- before_fork(): تُغلق اتصالات قاعدة البيانات في العملية الرئيسية وتُجمّد الكائنات
+  الحالية (gc.freeze) حتى لا يلمسها جامع القمامة في العمال فتُنسخ صفحاتها
+- after_fork() في كل عامل: مجمع اتصالات جديد (engine.dispose(close=False))، وعملاء HTTP
+  جدد (HTTP_CLIENTS وعميل التخزين) بدل مقابس keep-alive الموروثة، وبدء انتخاب
+  قائد المجدول. الموارد غير الآمنة عبر fork (الاتصالات، المجدول، الخيوط) تُنشأ هنا فقط؛
+  مجمعات الخيوط في الخدمات تنشئ خيوطها عند أول مهمة
+
+قياس الذاكرة لكل عامل بالوضعين: flask preload-benchmark
+"""
+import gc
+import json
+import logging
+import os
+import signal
+import subprocess
+import sys
+import time
+
+logger = logging.getLogger(__name__)
+
+ENABLED = os.environ.get('PRELOAD_APP', '').lower() in ('1', 'true', 'yes')
+
+# مكتبات التقارير المؤجلة (utils.lazy_imports) التي تُستورد في العملية الرئيسية
+PRELOAD_MODULES = ('pandas', 'openpyxl', 'xlsxwriter', 'reportlab.platypus', 'fpdf', 'arabic_reshaper',
+                   'bidi.algorithm')
+
+# صفحات يطلبها كل عامل في القياس قبل قراءة ذاكرته
+BENCHMARK_PATHS = ('/login', '/about')
+
+# عملاء HTTP مشتركة على مستوى الصنف تُنشأ عند أول استخدام: (الوحدة، الصنف، الخصائص)
+HTTP_CLIENTS = (
+    ('services.email_queue', 'SendGridTransport', ('_session',)),
+    ('services.drive_sync', 'DriveClient', ('_session', '_token', '_token_at')),
+)
+
+
+def warm(app):
+    """
+    بناء الحالة المشتركة للقراءة فقط في العملية الرئيسية
+
+    :return: dict بعدد القوالب والخطوط والمكتبات وجداول البحث المحملة
+    """
+    import importlib
+
+    from utils.pdf import preload_fonts
+
+    started = time.monotonic()
+    env = app.jinja_env
+    names = env.list_templates(extensions=('html', 'txt', 'xml'))
+    # ذاكرة القوالب الافتراضية (LRU) قد تكون أصغر من عدد القوالب
+    capacity = getattr(env.cache, 'capacity', None)
+    if capacity is not None and capacity < len(names):
+        env.cache = {}
+    templates = 0
+    for name in names:
+        try:
+            env.get_template(name)
+            templates += 1
+        except Exception as e:
+            logger.warning(f"تعذر ترجمة القالب {name}: {e}")
+
+    fonts = preload_fonts()
+
+    modules = []
+    for name in PRELOAD_MODULES:
+        try:
+            importlib.import_module(name)
+            modules.append(name)
+        except ImportError as e:
+            logger.warning(f"تعذر تحميل {name} مسبقاً: {e}")
+
+    lookups = _warm_lookups(app)
+
+    stats = {'templates': templates, 'fonts': len(fonts), 'modules': len(modules), 'lookups': lookups,
+             'seconds': round(time.monotonic() - started, 2)}
+    logger.info(f"التحميل المسبق: {stats}")
+    return stats
+
+
+def _warm_lookups(app):
+    """جداول البحث الثابتة التي تُبنى عند أول استخدام؛ لا تقرأ من قاعدة البيانات"""
+    import mimetypes
+
+    from sqlalchemy.orm import configure_mappers
+
+    from services import backup_engine
+
+    steps = (
+        ('mappers', configure_mappers),
+        ('url_map', app.url_map.update),
+        ('mimetypes', mimetypes.init),
+        ('backup_tables', backup_engine._tracked),
+    )
+    built = 0
+    for name, build in steps:
+        try:
+            build()
+            built += 1
+        except Exception as e:
+            logger.warning(f"تعذر بناء {name} مسبقاً: {e}")
+    return built
+
+
+def before_fork(app):
+    """قبل إنشاء العمال: لا اتصالات مفتوحة تُورث، وتجميد الكائنات الحالية"""
+    from app import db
+
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose()
+    gc.collect()
+    gc.freeze()
+
+
+def after_fork(app):
+    """في كل عامل بعد fork: مجمع اتصالات وعملاء HTTP خاصة بالعامل وبدء المجدول"""
+    from app import db
+    from services import scheduler
+
+    with app.app_context():
+        # الاتصالات الموروثة (إن وُجدت) تُترك للعملية الرئيسية دون إغلاقها من العامل
+        for engine in db.engines.values():
+            engine.dispose(close=False)
+    _reset_http_clients()
+    scheduler.start(app)
+
+
+def _reset_http_clients():
+    """
+    عملاء HTTP الموروثة من العملية الرئيسية تُسقط ليُنشئ كل عامل عميله عند أول استخدام
+
+    مقبس keep-alive مفتوح قبل fork (من أمر تشغيل أو مهمة في العملية الرئيسية) يصبح مشتركاً
+    بين العمال فتختلط الطلبات والردود. الأقفال تُستبدل أيضاً فقد تُورث مقفلة.
+    """
+    import threading
+
+    for module_name, class_name, attributes in HTTP_CLIENTS:
+        module = sys.modules.get(module_name)
+        if module is None:
+            # لم تُستورد قبل fork: ينشئها العامل بنفسه
+            continue
+        cls = getattr(module, class_name)
+        for attribute in attributes:
+            setattr(cls, attribute, None)
+        for attribute in ('_lock', '_session_lock'):
+            if attribute in vars(cls):
+                setattr(cls, attribute, threading.Lock())
+
+    storage = sys.modules.get('utils.storage_helper')
+    if storage is not None and storage.client is not None:
+        try:
+            storage.client = storage.Client()
+        except Exception as e:
+            logger.warning(f"تعذر إنشاء عميل التخزين في العامل: {e}")
+            storage.client = None
+
+
+def memory(pid='self'):
+    """
+    ذاكرة عملية من /proc بالميغابايت
+
+    rss: الصفحات المقيمة، pss: حصتها من الصفحات المشتركة، uss: صفحاتها الخاصة فقط
+    (ما يُحرر فعلاً إذا انتهت العملية)، shared: المشتركة مع عمليات أخرى
+    """
+    values = {}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as handle:
+            for line in handle:
+                parts = line.split()
+                if len(parts) >= 2 and parts[0].endswith(':') and parts[1].isdigit():
+                    values[parts[0][:-1]] = int(parts[1])
+    except OSError:
+        import resource
+        values['Rss'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    private = values.get('Private_Clean', 0) + values.get('Private_Dirty', 0)
+    shared = values.get('Shared_Clean', 0) + values.get('Shared_Dirty', 0)
+    return {
+        'rss': round(values.get('Rss', 0) / 1024, 1),
+        'pss': round(values.get('Pss', 0) / 1024, 1),
+        'uss': round(private / 1024, 1),
+        'shared': round(shared / 1024, 1),
+    }
+
+
+def _measure(workers, preload, paths):
+    """
+    تشغيل عمال بـ fork كما يفعل gunicorn وقياس ذاكرة كل عامل (في عملية قياس مستقلة)
+
+    كل عامل يُقاس في حالته المستقرة: بعد warm() (القوالب والخطوط ومكتبات التقارير التي
+    يحملها العامل عادة بعد فترة من الخدمة) وبعد طلب paths.
+    """
+    app = None
+    if preload:
+        from app import app
+        warm(app)
+        before_fork(app)
+    master = memory()
+
+    children = []
+    for _ in range(workers):
+        ready_read, ready_write = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(ready_read)
+            try:
+                if app is None:
+                    from app import app
+                else:
+                    after_fork(app)
+                warm(app)
+                client = app.test_client()
+                for path in paths:
+                    client.get(path)
+                os.write(ready_write, b'1')
+                signal.pause()
+            finally:
+                os._exit(0)
+        os.close(ready_write)
+        children.append((pid, ready_read))
+
+    results = []
+    for pid, ready_read in children:
+        os.read(ready_read, 1)
+        os.close(ready_read)
+    for pid, _ in children:
+        results.append(memory(pid))
+    for pid, _ in children:
+        os.kill(pid, signal.SIGTERM)
+        os.waitpid(pid, 0)
+    return {'preload': preload, 'master': master, 'workers': results}
+
+
+def benchmark(workers=2, paths=BENCHMARK_PATHS):
+    """
+    قياس ذاكرة العمال بدون التحميل المسبق ومعه، كل وضع في عملية جديدة
+
+    :return: قائمة بنتيجتين {preload, master, workers: [ذاكرة كل عامل]}
+    """
+    results = []
+    for preload in (False, True):
+        env = dict(os.environ, SCHEDULER_ENABLED='0', PRELOAD_APP='1' if preload else '0')
+        code = ("import json; from services import preload; "
+                f"print('BENCHMARK' + json.dumps(preload._measure({int(workers)}, {preload}, {list(paths)!r})))")
+        output = subprocess.run([sys.executable, '-c', code], env=env, capture_output=True, text=True)
+        line = next((line for line in output.stdout.splitlines() if line.startswith('BENCHMARK')), None)
+        if line is None:
+            raise RuntimeError(output.stderr.strip().splitlines()[-1] if output.stderr.strip() else 'benchmark failed')
+        results.append(json.loads(line[len('BENCHMARK'):]))
+    return results
@@ -0,0 +1,491 @@
+"""
+طبقة بيانات التقارير المشتركة بين صفحات HTML وملفات PDF و Excel
+
+كل تقرير (الموظفين، الحضور، الرواتب، الوثائق) كان يعيد استعلاماته في كل صيغة تصدير،
+وبعضها بحلقات لكل قسم ولكل موظف (dept.employees الكسولة، next(...) لكل سجل، استعلام
+راتب لكل موظف). الآن:
+
+- بيانات التقرير تُبنى مرة واحدة باستعلامات مجمعة (اسم القسم باستعلام فرعي مرتبط بدل
+  employee.department لكل صف) في بنية أعمدة: {اسم العمود: قائمة قيم}
+- النتيجة تُحفظ في ذاكرة العملية حسب مفتاح الفلاتر لمدة REPORT_CACHE_SECONDS، فتصدير
+  نفس التقرير بصيغتين يكلف تمريرة استعلام واحدة
+- أي حفظ لجدول يعتمد عليه التقرير يُسقط نسخته المخزنة فوراً في كل العمليات: مثل
+  services.user_cache، لكل جدول ملف إشارة في instance/report_signals يُلمس بعد commit
+  ناجح، ووقت تعديله هو جيل الجدول (استدعاء stat لكل جدول بدل الاستعلام)
+
+أسماء الأعمدة منقطة ('employee.name'، 'employee.department.name')، و rows() تعيدها
+كائنات بنفس شكل نماذج ORM التي تستخدمها القوالب (employee.department.name ...).
+فلتر القسم في كل التقارير هو عضوية الموظف في القسم (employee_departments)، وهو نفس
+مصدر employee.department المعروض.
+"""
+import logging
+import os
+import threading
+import time
+from datetime import date, datetime, timedelta
+from types import SimpleNamespace
+
+from sqlalchemy import and_, event, select
+from sqlalchemy.orm import Session
+
+from app import db
+from models import Attendance, Department, Document, Employee, Nationality, Salary, employee_departments
+
+logger = logging.getLogger(__name__)
+
+CACHE_SECONDS = int(os.environ.get('REPORT_CACHE_SECONDS', 120))
+CACHE_SIZE = int(os.environ.get('REPORT_CACHE_SIZE', 32))
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SIGNALS_DIR = os.path.join(PROJECT_ROOT, 'instance', 'report_signals')
+
+# الجداول التي يُبنى منها كل تقرير
+DEPENDS = {
+    'employees': ('employee', 'department', 'employee_departments', 'nationalities'),
+    'attendance': ('attendance', 'employee', 'department', 'employee_departments'),
+    'salaries': ('salary', 'employee', 'department', 'employee_departments'),
+    'documents': ('document', 'employee', 'department', 'employee_departments'),
+}
+_TRACKED = {table for tables in DEPENDS.values() for table in tables}
+
+# حالات الموظف المستبعدة من كشوف الأقسام في تقرير الحضور
+INACTIVE_STATUSES = ('terminated', 'inactive')
+
+# (نوع التقرير، مفتاح الفلاتر) -> (وقت الانتهاء، أجيال الجداول، ReportDataset)
+_cache = {}
+_building = {}
+_lock = threading.Lock()
+
+
+class ReportDataset:
+    """نتيجة تقرير بصيغة أعمدة متساوية الطول، مع ملخصات محسوبة مسبقاً في meta"""
+
+    def __init__(self, columns, meta=None):
+        self.columns = columns
+        self.meta = meta or {}
+        self.built_at = datetime.now()
+
+    def __len__(self):
+        return len(next(iter(self.columns.values()), ()))
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def mask(self, name, value):
+        """قناع صفوف العمود المساوية للقيمة، أو None إذا كانت القيمة فارغة (بدون فلترة)"""
+        if not value:
+            return None
+        return [v == value for v in self.columns[name]]
+
+    def rows(self, *groups, mask=None):
+        """
+        صفوف التقرير ككائنات: rows('attendance', 'employee') تعيد [(attendance, employee)]
+        و rows('employee') تعيد [employee]
+        """
+        paths = [(name, name.split('.')) for name in self.columns if name.split('.', 1)[0] in groups]
+        indexes = range(len(self)) if mask is None else [i for i, keep in enumerate(mask) if keep]
+        result = []
+        for i in indexes:
+            tree = {}
+            for name, path in paths:
+                node = tree
+                for part in path[:-1]:
+                    node = node.setdefault(part, {})
+                node[path[-1]] = self.columns[name][i]
+            records = tuple(_namespace(tree.get(group, {})) or SimpleNamespace() for group in groups)
+            result.append(records if len(groups) > 1 else records[0])
+        return result
+
+
+def _namespace(tree):
+    """قاموس متداخل إلى كائن؛ العلاقة التي كل قيمها فارغة تصبح None (مثل employee.department)"""
+    values = {}
+    for key, value in tree.items():
+        values[key] = _namespace(value) if isinstance(value, dict) else value
+    if all(value is None for value in values.values()):
+        return None
+    return SimpleNamespace(**values)
+
+
+def _columnar(names, rows):
+    if not rows:
+        return {name: [] for name in names}
+    return dict(zip(names, map(list, zip(*rows))))
+
+
+def _select(columns, *where, order_by=(), joins=()):
+    """تنفيذ استعلام أعمدة مسماة وإعادة (الأسماء، الصفوف)"""
+    names = [name for name, _ in columns]
+    query = select(*[expr for _, expr in columns])
+    for target, onclause in joins:
+        query = query.outerjoin(target, onclause)
+    query = query.where(*where).order_by(*order_by)
+    return names, [tuple(row) for row in db.session.execute(query)]
+
+
+# ---------------------------------------------------------------------------
+# الذاكرة المؤقتة
+# ---------------------------------------------------------------------------
+
+def _generation(table):
+    """جيل الجدول: وقت تعديل ملف إشارته (0 إذا لم يُحفظ أي تغيير عليه بعد)"""
+    try:
+        return os.stat(os.path.join(SIGNALS_DIR, table)).st_mtime_ns
+    except OSError:
+        return 0
+
+
+def _touch(table):
+    path = os.path.join(SIGNALS_DIR, table)
+    now = time.time_ns()
+    try:
+        try:
+            os.utime(path, ns=(now, now))
+        except FileNotFoundError:
+            os.makedirs(SIGNALS_DIR, exist_ok=True)
+            open(path, 'a').close()
+            os.utime(path, ns=(now, now))
+    except OSError as e:
+        logger.warning(f"تعذر تحديث إشارة التقارير {path}: {e}")
+        # على الأقل لا تبقى نسخ هذه العملية قديمة
+        clear()
+
+
+def _stamp(kind):
+    return tuple(_generation(table) for table in DEPENDS[kind])
+
+
+def _cached(kind, key, build):
+    cache_key = (kind, key)
+    with _lock:
+        entry = _cache.get(cache_key)
+        if entry and entry[0] > time.monotonic() and entry[1] == _stamp(kind):
+            return entry[2]
+        building = _building.setdefault(cache_key, threading.Lock())
+
+    # طلبان متزامنان لنفس التقرير (PDF و Excel) يبنيانه مرة واحدة
+    with building:
+        with _lock:
+            entry = _cache.get(cache_key)
+            if entry and entry[0] > time.monotonic() and entry[1] == _stamp(kind):
+                return entry[2]
+            stamp = _stamp(kind)
+        dataset = build()
+        with _lock:
+            _cache[cache_key] = (time.monotonic() + CACHE_SECONDS, stamp, dataset)
+            while len(_cache) > CACHE_SIZE:
+                _cache.pop(min(_cache, key=lambda k: _cache[k][0]))
+            _building.pop(cache_key, None)
+    return dataset
+
+
+def clear():
+    """مسح كل التقارير المخزنة في هذه العملية"""
+    with _lock:
+        _cache.clear()
+
+
+def _changed_tables(session):
+    return session.info.setdefault('report_changed_tables', set())
+
+
+@event.listens_for(Session, 'after_flush')
+def _track_flush(session, flush_context):
+    changed = _changed_tables(session)
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        table = getattr(obj, '__table__', None)
+        if table is not None and table.name in _TRACKED:
+            changed.add(table.name)
+            if table.name == 'employee':
+                # تعديل أقسام الموظف يظهر ككائن موظف معدل
+                changed.add('employee_departments')
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def _track_bulk(orm_execute_state):
+    if not (orm_execute_state.is_update or orm_execute_state.is_delete or orm_execute_state.is_insert):
+        return
+    mapper = orm_execute_state.bind_mapper
+    if mapper is not None and mapper.local_table.name in _TRACKED:
+        _changed_tables(orm_execute_state.session).add(mapper.local_table.name)
+
+
+@event.listens_for(Session, 'after_commit')
+def _bump_generations(session):
+    # بعد الحفظ لا قبله: تقرير يُبنى بين flush و commit لا يُحفظ بجيل الجداول الجديد
+    changed = session.info.pop('report_changed_tables', None)
+    for table in sorted(changed or ()):
+        _touch(table)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_changes(session):
+    session.info.pop('report_changed_tables', None)
+
+
+# ---------------------------------------------------------------------------
+# أجزاء مشتركة للاستعلامات
+# ---------------------------------------------------------------------------
+
+def _int_or_none(value):
+    try:
+        return int(value) if value not in (None, '') else None
+    except (TypeError, ValueError):
+        return None
+
+
+def _first_department(column):
+    """عمود من أول قسم للموظف (employee.department) كاستعلام فرعي مرتبط"""
+    return (
+        select(column)
+        .join(employee_departments, employee_departments.c.department_id == Department.id)
+        .where(employee_departments.c.employee_id == Employee.id)
+        .order_by(Department.id)
+        .limit(1)
+        .scalar_subquery()
+    )
+
+
+def _employee_columns(*fields, prefix='employee'):
+    columns = [(f'{prefix}.{field}', getattr(Employee, field)) for field in fields]
+    columns.append((f'{prefix}.department.id', _first_department(Department.id)))
+    columns.append((f'{prefix}.department.name', _first_department(Department.name)))
+    return columns
+
+
+def _in_department(department_id):
+    return Employee.id.in_(
+        select(employee_departments.c.employee_id)
+        .where(employee_departments.c.department_id == department_id)
+    )
+
+
+def _department_name(department_id):
+    if department_id is None:
+        return None
+    return db.session.execute(
+        select(Department.name).where(Department.id == department_id)
+    ).scalar()
+
+
+# ---------------------------------------------------------------------------
+# تقرير الموظفين
+# ---------------------------------------------------------------------------
+
+def employees(department_id='', status=''):
+    """الموظفون بكل حقولهم مع قائمة أقسامهم وجنسيتهم"""
+    department_id = _int_or_none(department_id)
+    status = status or None
+    return _cached('employees', (department_id, status),
+                   lambda: _build_employees(department_id, status))
+
+
+def _build_employees(department_id, status):
+    conditions = []
+    if department_id is not None:
+        conditions.append(_in_department(department_id))
+    if status:
+        conditions.append(Employee.status == status)
+
+    columns = [(f'employee.{column.key}', column) for column in Employee.__table__.columns]
+    columns.append(('employee.nationality_rel.name_ar', Nationality.name_ar))
+    names, rows = _select(columns, *conditions, order_by=(Employee.id,),
+                          joins=((Nationality, Nationality.id == Employee.nationality_id),))
+    data = _columnar(names, rows)
+
+    # أقسام كل الموظفين المختارين باستعلام واحد
+    memberships = {}
+    query = (
+        select(employee_departments.c.employee_id, Department.id, Department.name)
+        .join(Department, Department.id == employee_departments.c.department_id)
+        .where(employee_departments.c.employee_id.in_(select(Employee.id).where(*conditions)))
+        .order_by(Department.id)
+    )
+    for employee_id, dept_id, dept_name in db.session.execute(query):
+        memberships.setdefault(employee_id, []).append(SimpleNamespace(id=dept_id, name=dept_name))
+
+    departments = [memberships.get(employee_id, []) for employee_id in data['employee.id']]
+    data['employee.departments'] = departments
+    data['employee.department.id'] = [d[0].id if d else None for d in departments]
+    data['employee.department.name'] = [d[0].name if d else None for d in departments]
+    return ReportDataset(data, {'department_name': _department_name(department_id)})
+
+
+# ---------------------------------------------------------------------------
+# تقرير الحضور
+# ---------------------------------------------------------------------------
+
+def attendance(from_date, to_date, department_id=''):
+    """
+    سجلات الحضور في الفترة بكل حالاتها (فلتر الحالة يُطبق عند العرض بـ mask)، مع ملخص
+    لكل قسم في meta['departments'] وخريطة {الموظف: {التاريخ: الحالة}} في meta['days']
+    """
+    department_id = _int_or_none(department_id)
+    return _cached('attendance', (str(from_date), str(to_date), department_id),
+                   lambda: _build_attendance(from_date, to_date, department_id))
+
+
+def _build_attendance(from_date, to_date, department_id):
+    conditions = [Attendance.date.between(from_date, to_date)]
+    if department_id is not None:
+        conditions.append(_in_department(department_id))
+
+    columns = [(f'attendance.{field}', getattr(Attendance, field))
+               for field in ('id', 'date', 'check_in', 'check_out', 'status', 'notes')]
+    columns += _employee_columns('id', 'name', 'employee_id')
+    names, rows = _select(columns, *conditions,
+                          order_by=(Attendance.date.desc(), Attendance.id),
+                          joins=((Employee, Employee.id == Attendance.employee_id),))
+    data = _columnar(names, rows)
+
+    # فهرس سجلات كل موظف وحالاته اليومية
+    records_by_employee = {}
+    days = {}
+    for i, (employee_id, day, status) in enumerate(zip(
+            data['employee.id'], data['attendance.date'], data['attendance.status'])):
+        records_by_employee.setdefault(employee_id, []).append(i)
+        days.setdefault(employee_id, {})[day] = status
+
+    # كشف موظفي كل قسم (غير المنتهية خدمتهم) باستعلام واحد
+    roster_fields = ('id', 'name', 'employee_id', 'national_id', 'mobile', 'job_title', 'location', 'project')
+    query = (
+        select(Department.id, Department.name, *[getattr(Employee, f) for f in roster_fields])
+        .join(employee_departments, employee_departments.c.department_id == Department.id)
+        .join(Employee, Employee.id == employee_departments.c.employee_id)
+        .where(Employee.status.notin_(INACTIVE_STATUSES))
+        .order_by(Department.id, Employee.id)
+    )
+    if department_id is not None:
+        query = query.where(Department.id == department_id)
+
+    departments = {}
+    for row in db.session.execute(query):
+        dept = departments.setdefault(row[0], {'id': row[0], 'name': row[1], 'employees': []})
+        dept['employees'].append(SimpleNamespace(**dict(zip(roster_fields, row[2:]))))
+
+    summaries = []
+    for dept in departments.values():
+        counts = {'present': 0, 'absent': 0, 'leave': 0, 'sick': 0}
+        lists = {'absent': [], 'leave': [], 'sick': []}
+        total = 0
+        for employee in dept['employees']:
+            for i in records_by_employee.get(employee.id, ()):
+                status = data['attendance.status'][i]
+                total += 1
+                if status in counts:
+                    counts[status] += 1
+                if status in lists:
+                    lists[status].append({
+                        'name': employee.name,
+                        'employee_id': employee.employee_id,
+                        'date': data['attendance.date'][i],
+                        'notes': data['attendance.notes'][i],
+                    })
+        summaries.append({
+            'id': dept['id'],
+            'name': dept['name'],
+            'roster': dept['employees'],
+            'employees': len(dept['employees']),
+            'present': counts['present'],
+            'absent': counts['absent'],
+            'leave': counts['leave'],
+            'sick': counts['sick'],
+            'total': total,
+            'rate': round(counts['present'] / total * 100, 1) if total else 0,
+            'absentees': lists['absent'],
+            'on_leave': lists['leave'],
+            'sick_list': lists['sick'],
+        })
+
+    return ReportDataset(data, {
+        'department_name': _department_name(department_id),
+        'departments': summaries,
+        'days': days,
+    })
+
+
+# ---------------------------------------------------------------------------
+# تقرير الرواتب
+# ---------------------------------------------------------------------------
+
+SALARY_FIELDS = ('basic_salary', 'allowances', 'deductions', 'bonus', 'net_salary')
+
+
+def salaries(month, year, department_id=''):
+    """الموظفون النشطون مع راتب الشهر (أو بدونه: has_salary=False) والإجماليات في meta"""
+    department_id = _int_or_none(department_id)
+    return _cached('salaries', (int(month), int(year), department_id),
+                   lambda: _build_salaries(int(month), int(year), department_id))
+
+
+def _build_salaries(month, year, department_id):
+    conditions = [Employee.status == 'active']
+    if department_id is not None:
+        conditions.append(_in_department(department_id))
+
+    columns = _employee_columns('id', 'name', 'employee_id', 'job_title')
+    columns += [('salary.id', Salary.id)]
+    columns += [(f'salary.{field}', getattr(Salary, field)) for field in SALARY_FIELDS]
+    salary_join = and_(Salary.employee_id == Employee.id, Salary.month == month, Salary.year == year)
+    names, rows = _select(columns, *conditions, order_by=(Employee.id, Salary.id),
+                          joins=((Salary, salary_join),))
+
+    # راتب واحد لكل موظف (الأول) كما في الاستعلام السابق .first()
+    seen = set()
+    employee_index = names.index('employee.id')
+    unique = []
+    for row in rows:
+        if row[employee_index] not in seen:
+            seen.add(row[employee_index])
+            unique.append(row)
+    data = _columnar(names, unique)
+    data['salary.has_salary'] = [salary_id is not None for salary_id in data['salary.id']]
+
+    totals = dict.fromkeys(('basic', 'allowances', 'deductions', 'bonus', 'net'), 0)
+    for key, field in zip(totals, SALARY_FIELDS):
+        totals[key] = sum(v or 0 for v, has in zip(data[f'salary.{field}'], data['salary.has_salary']) if has)
+
+    return ReportDataset(data, {'department_name': _department_name(department_id), 'totals': totals})
+
+
+def salary_items(dataset, only_paid=False):
+    """صفوف الرواتب بالشكل الذي تستخدمه القوالب ومولد PDF: {'employee', 'basic_salary', ..., 'has_salary'}"""
+    mask = dataset['salary.has_salary'] if only_paid else None
+    items = []
+    for salary, employee in dataset.rows('salary', 'employee', mask=mask):
+        item = {'id': salary.id, 'employee': employee, 'has_salary': salary.has_salary}
+        for field in SALARY_FIELDS:
+            item[field] = getattr(salary, field) if salary.has_salary else 0
+        items.append(item)
+    return items
+
+
+# ---------------------------------------------------------------------------
+# تقرير الوثائق
+# ---------------------------------------------------------------------------
+
+def documents(department_id='', document_type='', expiring_only=False, expiry_days=30):
+    """وثائق الموظفين مرتبة بتاريخ الانتهاء"""
+    department_id = _int_or_none(department_id)
+    document_type = document_type or None
+    today = date.today()
+    key = (department_id, document_type, bool(expiring_only), int(expiry_days), today)
+    return _cached('documents', key, lambda: _build_documents(
+        department_id, document_type, expiring_only, today + timedelta(days=int(expiry_days))))
+
+
+def _build_documents(department_id, document_type, expiring_only, cutoff_date):
+    conditions = []
+    if department_id is not None:
+        conditions.append(_in_department(department_id))
+    if document_type:
+        conditions.append(Document.document_type == document_type)
+    if expiring_only:
+        conditions.append(Document.expiry_date <= cutoff_date)
+
+    columns = [(f'document.{field}', getattr(Document, field))
+               for field in ('id', 'document_type', 'document_number', 'issue_date', 'expiry_date', 'notes')]
+    columns += _employee_columns('id', 'name', 'employee_id')
+    names, rows = _select(columns, *conditions, order_by=(Document.expiry_date, Document.id),
+                          joins=((Employee, Employee.id == Document.employee_id),))
+    return ReportDataset(_columnar(names, rows), {'department_name': _department_name(department_id)})
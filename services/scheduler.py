@@ -0,0 +1,349 @@
+"""
+مجدول المهام الخلفية بقائد واحد
+
+كان كل عامل gunicorn (وكل أمر flask) يشغّل BackgroundScheduler خاصاً به، ويحذف المواقع
+وأحداث الدوائر الجغرافية القديمة بأمر DELETE واحد غير محدود أثناء الإقلاع. الآن:
+
+- كل عملية تحاول أن تصبح القائد، والقائد وحده يشغّل المهام:
+  PostgreSQL: قفل استشاري (pg_try_advisory_lock) على اتصال مخصص يبقى مفتوحاً؛ يتحرر
+  تلقائياً عند انتهاء العملية أو انقطاع الاتصال، ويُفك صراحة عند التنحي. غير ذلك (SQLite محلياً): قفل ملف (flock)
+  العمليات الأخرى تعيد المحاولة كل ELECTION_SECONDS ثانية فتتولى القيادة إذا توقف القائد
+- الإقلاع لا ينتظر أي مهمة: أول تشغيل لمهام التنظيف بعد FIRST_RUN_DELAY ثانية من
+  تولي القيادة، في خيط المجدول
+- حذف الاحتفاظ على دفعات (delete_in_batches): BATCH_SIZE سجل لكل معاملة قصيرة ثم
+  استراحة BATCH_PAUSE ثانية، فلا تُقفل الجداول طويلاً
+- كل تشغيل يُسجل في scheduler_job_runs (المدة، السجلات المتأثرة، الخطأ)، ويعرضه
+  status() وأمر flask scheduler وواجهة /admin/api/scheduler
+
+المهام تُسجل بالمزخرف job() ويجب أن تعيد عدد السجلات المتأثرة (أو None).
+SCHEDULER_ENABLED=0 يوقف المجدول في العملية (مثلاً لعمليات الويب إذا شُغّل عامل منفصل).
+"""
+import logging
+import os
+import socket
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, select, text
+
+from app import db
+
+logger = logging.getLogger(__name__)
+
+ENABLED = os.environ.get('SCHEDULER_ENABLED', '1').lower() not in ('0', 'false', 'no')
+LOCK_FILE = os.environ.get('SCHEDULER_LOCK_FILE', os.path.join('instance', 'scheduler.lock'))
+ADVISORY_LOCK_KEY = 0x6E757A6D  # "nuzm"
+ELECTION_SECONDS = 30
+FIRST_RUN_DELAY = 60
+BATCH_SIZE = int(os.environ.get('RETENTION_BATCH_SIZE', 2000))
+BATCH_PAUSE = float(os.environ.get('RETENTION_BATCH_PAUSE', 0.1))
+HISTORY_DAYS = 14
+
+STATUS_SUCCESS = 'success'
+STATUS_ERROR = 'error'
+
+WORKER = f"{socket.gethostname()}:{os.getpid()}"
+
+# اسم المهمة -> (الدالة، خيارات التكرار، تشغيل مبكر بعد تولي القيادة)
+_jobs = OrderedDict()
+_state = {'leader': False, 'backend': None, 'since': None, 'scheduler': None}
+_stop = threading.Event()
+_lock = threading.Lock()
+_thread = None
+_leadership = None
+
+
+def job(name, run_soon=False, **interval):
+    """تسجيل مهمة دورية (interval بصيغة APScheduler: minutes=1، hours=6 ...)"""
+    def decorator(func):
+        _jobs[name] = (func, interval, run_soon)
+        return func
+    return decorator
+
+
+def job_names():
+    """أسماء المهام المسجلة"""
+    return list(_jobs)
+
+
+def delete_in_batches(table, *conditions, batch_size=None, pause=None, before_delete=None):
+    """
+    حذف السجلات المطابقة على دفعات بمعاملات قصيرة
+
+    :param table: النموذج أو الجدول (بمفتاح أساسي id)
+    :param before_delete: دالة تُستدعى بمعرفات كل دفعة قبل حذفها (مثلاً لفك المراجع)
+    :return: عدد السجلات المحذوفة
+    """
+    table = getattr(table, '__table__', table)
+    batch_size = batch_size or BATCH_SIZE
+    pause = BATCH_PAUSE if pause is None else pause
+    total = 0
+    while not _stop.is_set():
+        ids = db.session.execute(select(table.c.id).where(*conditions).limit(batch_size)).scalars().all()
+        if not ids:
+            break
+        if before_delete is not None:
+            before_delete(ids)
+        total += db.session.execute(delete(table).where(table.c.id.in_(ids))).rowcount
+        db.session.commit()
+        if len(ids) < batch_size:
+            break
+        time.sleep(pause)
+    return total
+
+
+def run(name, app=None):
+    """
+    تشغيل مهمة مسجلة الآن وتسجيل نتيجتها
+
+    :return: عدد السجلات المتأثرة (None إذا فشلت المهمة)
+    """
+    from flask import current_app
+    from models import SchedulerJobRun
+
+    app = app or current_app._get_current_object()
+    func = _jobs[name][0]
+    with app.app_context():
+        started_at = datetime.utcnow()
+        started = time.monotonic()
+        rows, status, error = None, STATUS_SUCCESS, None
+        try:
+            rows = func()
+        except Exception as e:
+            db.session.rollback()
+            status, error = STATUS_ERROR, str(e)
+            logger.exception(f"فشل تشغيل المهمة {name}")
+        duration_ms = int((time.monotonic() - started) * 1000)
+        try:
+            db.session.add(SchedulerJobRun(job_name=name, started_at=started_at, finished_at=datetime.utcnow(),
+                                           duration_ms=duration_ms, rows_affected=rows, status=status,
+                                           error=error, worker=WORKER))
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"تعذر تسجيل تشغيل المهمة {name}: {e}")
+        finally:
+            db.session.remove()
+        if rows:
+            logger.info(f"المهمة {name}: {rows} سجل في {duration_ms} ms")
+        return rows
+
+
+class _AdvisoryLock:
+    """قيادة بقفل PostgreSQL الاستشاري على اتصال مخصص"""
+    backend = 'postgresql'
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.connection = None
+
+    def acquire(self):
+        try:
+            connection = self.engine.connect()
+            if connection.execute(text("SELECT pg_try_advisory_lock(:key)"), {'key': ADVISORY_LOCK_KEY}).scalar():
+                connection.commit()
+                self.connection = connection
+                return True
+            connection.close()
+        except Exception as e:
+            logger.warning(f"تعذر محاولة قيادة المجدول: {e}")
+        return False
+
+    def alive(self):
+        try:
+            self.connection.execute(text("SELECT 1"))
+            self.connection.commit()
+            return True
+        except Exception as e:
+            logger.warning(f"انقطع اتصال قفل المجدول: {e}")
+            return False
+
+    def release(self):
+        """
+        فك القفل قبل إعادة الاتصال للمجمع
+
+        القفل الاستشاري مرتبط بجلسة PostgreSQL لا بالمعاملة، وإغلاق الاتصال يعيده للمجمع
+        مفتوحاً فيبقى القفل محجوزاً ولا تستطيع أي عملية أخرى القيادة. إذا تعذر فكه (اتصال
+        منقطع) يُتلف الاتصال بدل إعادته، فيُغلق في PostgreSQL ويسقط القفل معه.
+        """
+        connection, self.connection = self.connection, None
+        if connection is None:
+            return
+        try:
+            connection.execute(text("SELECT pg_advisory_unlock(:key)"), {'key': ADVISORY_LOCK_KEY})
+            connection.commit()
+        except Exception as e:
+            logger.warning(f"تعذر فك قفل المجدول، سيُغلق الاتصال: {e}")
+            try:
+                connection.invalidate()
+            except Exception:
+                pass
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+
+class _FileLock:
+    """قيادة بقفل ملف (للتشغيل على جهاز واحد، مثل SQLite محلياً)"""
+    backend = 'file'
+
+    def __init__(self, path):
+        self.path = path
+        self.handle = None
+
+    def acquire(self):
+        try:
+            import fcntl
+        except ImportError:
+            # بدون flock (Windows) تُفترض عملية واحدة
+            return True
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        handle = open(self.path, 'a+')
+        try:
+            fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            handle.close()
+            return False
+        handle.seek(0)
+        handle.truncate()
+        handle.write(WORKER)
+        handle.flush()
+        self.handle = handle
+        return True
+
+    def alive(self):
+        return True
+
+    def release(self):
+        if self.handle is not None:
+            self.handle.close()
+            self.handle = None
+
+
+def _become_leader(app):
+    from apscheduler.schedulers.background import BackgroundScheduler
+
+    scheduler = BackgroundScheduler(job_defaults={'coalesce': True, 'max_instances': 1})
+    first_run = datetime.now() + timedelta(seconds=FIRST_RUN_DELAY)
+    for name, (_, interval, run_soon) in _jobs.items():
+        options = {'next_run_time': first_run} if run_soon else {}
+        scheduler.add_job(run, 'interval', args=(name, app), id=name, name=name, **interval, **options)
+    scheduler.start()
+    with _lock:
+        _state.update(leader=True, backend=_leadership.backend, since=datetime.utcnow(), scheduler=scheduler)
+    logger.info(f"المجدول: هذه العملية ({WORKER}) هي القائد ({_leadership.backend})")
+
+
+def _step_down():
+    with _lock:
+        scheduler = _state['scheduler']
+        _state.update(leader=False, since=None, scheduler=None)
+    if scheduler is not None:
+        scheduler.shutdown(wait=False)
+    _leadership.release()
+
+
+def _elect(app):
+    while not _stop.is_set():
+        if not _state['leader']:
+            if _leadership.acquire():
+                _become_leader(app)
+        elif not _leadership.alive():
+            _step_down()
+        _stop.wait(ELECTION_SECONDS)
+    if _state['leader']:
+        _step_down()
+
+
+def _cli_process():
+    """أوامر flask (غير flask run) لا تشغّل المجدول"""
+    import sys
+    return os.environ.get('FLASK_RUN_FROM_CLI') == 'true' and 'run' not in sys.argv[1:2]
+
+
+def start(app):
+    """بدء انتخاب القائد في خيط خلفي (لا يؤخر إقلاع العملية)"""
+    global _thread, _leadership, WORKER
+    if not ENABLED or _cli_process() or _thread is not None:
+        return
+    # مع التحميل المسبق تُستورد الوحدة في العملية الرئيسية قبل fork
+    WORKER = f"{socket.gethostname()}:{os.getpid()}"
+    with app.app_context():
+        engine = db.engine
+    _leadership = _AdvisoryLock(engine) if engine.dialect.name == 'postgresql' else _FileLock(LOCK_FILE)
+    _thread = threading.Thread(target=_elect, args=(app,), name='scheduler-election', daemon=True)
+    _thread.start()
+
+
+def shutdown():
+    """إيقاف المجدول وتحرير القيادة (عند إنهاء العملية)"""
+    _stop.set()
+    if _state['leader']:
+        _step_down()
+
+
+def recent_runs(limit=50, job_name=None):
+    """آخر تشغيلات المهام (من كل العمليات)"""
+    from models import SchedulerJobRun
+
+    query = SchedulerJobRun.query
+    if job_name:
+        query = query.filter_by(job_name=job_name)
+    return query.order_by(SchedulerJobRun.started_at.desc()).limit(limit).all()
+
+
+def status():
+    """حالة المجدول في هذه العملية مع آخر تشغيل لكل مهمة"""
+    from models import SchedulerJobRun
+
+    with _lock:
+        scheduler = _state['scheduler']
+        state = dict(leader=_state['leader'], backend=_state['backend'], since=_state['since'])
+    next_runs = {}
+    if scheduler is not None:
+        next_runs = {item.id: item.next_run_time for item in scheduler.get_jobs()}
+
+    latest = {}
+    for name in _jobs:
+        last = (SchedulerJobRun.query.filter_by(job_name=name)
+                .order_by(SchedulerJobRun.started_at.desc()).first())
+        latest[name] = last
+
+    return {
+        'worker': WORKER,
+        'enabled': ENABLED,
+        'leader': state['leader'],
+        'backend': state['backend'],
+        'leader_since': state['since'].isoformat() if state['since'] else None,
+        'jobs': [{
+            'name': name,
+            'interval': dict(interval),
+            'next_run': next_runs[name].isoformat() if next_runs.get(name) else None,
+            'last_run': run_as_dict(latest[name]) if latest[name] else None,
+        } for name, (_, interval, _) in _jobs.items()],
+    }
+
+
+def run_as_dict(item):
+    """تشغيل مسجل كقاموس قابل للتحويل إلى JSON"""
+    return {
+        'job': item.job_name,
+        'started_at': item.started_at.isoformat(),
+        'duration_ms': item.duration_ms,
+        'rows_affected': item.rows_affected,
+        'status': item.status,
+        'error': item.error,
+        'worker': item.worker,
+    }
+
+
+@job('scheduler-history', hours=24)
+def prune_history():
+    """حذف سجل التشغيلات الأقدم من HISTORY_DAYS يوماً"""
+    from models import SchedulerJobRun
+
+    cutoff = datetime.utcnow() - timedelta(days=HISTORY_DAYS)
+    return delete_in_batches(SchedulerJobRun, SchedulerJobRun.started_at < cutoff)
@@ -0,0 +1,536 @@
+"""
+فهرس البحث الموحد للموظفين والمركبات والوثائق
+
+البحث في الصفحات كان LIKE '%term%' على أعمدة الجداول مباشرة: لا يستخدم أي فهرس، ولا
+يطابق اختلافات الإملاء العربي (أ/إ/آ/ا، ة/ه، ى/ي، التشكيل والتطويل، الأرقام الهندية).
+الآن:
+
+- جدول search_index (models.SearchEntry): صف لكل موظف ومركبة ووثيقة فيه keys (المعرفات
+  بدون مسافات: الرقم الوظيفي، الهوية، الجوال، اللوحة، رقم الوثيقة) و content (كل النص
+  القابل للبحث) بعد normalize()
+- فهرس نصي فوقه: FTS5 بمجزئ trigram على SQLite (جدول search_index_fts تُزامنه triggers)،
+  و pg_trgm (GIN) على PostgreSQL، فيُجاب البحث عن أي جزء من الكلمة من الفهرس
+- يُحدّث في نفس معاملة الحفظ (after_flush) عند إضافة أو تعديل أو حذف موظف أو مركبة أو
+  وثيقة، كما يفعل services.ledger_balances. التعديلات الجماعية (query.update) وحذف
+  الوثائق بـ CASCADE من قاعدة البيانات لا تمر بالأحداث؛ النتائج تُربط بالجداول الأصلية
+  دائماً فلا تظهر المحذوفات، و flask search-index --rebuild يعيد البناء
+- search() يرتب النتائج: تطابق المعرف كاملاً، ثم بدايته، ثم الكلمة كاملة، ثم بدايتها، ثم
+  أي جزء منها. إذا لم يطابق شيء يُجرب البحث التقريبي (تشابه trigrams) لأخطاء الإملاء
+- filter_query() يطبق البحث على استعلام قائم (مع الترتيب حسب الصلة اختيارياً)، وهو ما
+  تستخدمه الصفحات و /api/search
+
+ensure_schema() (إنشاء الفهرس النصي والبناء الأول) لا تعمل عند استيراد التطبيق: تشغلها مهمة
+المجدول search-index-setup على القائد فقط، أو flask search-index --rebuild. العمال التي
+بدأت قبلها تعيد فحص الفهرس كل BACKEND_RECHECK ثانية ما دامت على LIKE.
+
+SEARCH_INDEX=0 يعيد البحث إلى LIKE على النص الموحد بدون FTS أو pg_trgm.
+"""
+import logging
+import os
+import re
+import threading
+import time
+import unicodedata
+from datetime import datetime
+
+from sqlalchemy import case, delete, event, false, func, insert, inspect, or_, select, text
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+from app import db
+from models import Document, Employee, SearchEntry, Vehicle
+
+logger = logging.getLogger(__name__)
+
+ENABLED = os.environ.get('SEARCH_INDEX', '1').lower() not in ('0', 'false', 'no')
+
+FTS_TABLE = 'search_index_fts'
+
+# أقل تشابه (0..1) لقبول نتيجة تقريبية، وأقصى عدد مرشحين للبحث التقريبي
+FUZZY_THRESHOLD = 0.4
+FUZZY_CANDIDATES = 200
+
+REBUILD_BATCH = 500
+
+# أسماء أنواع الوثائق بالعربية (تُفهرس مع الرمز ليُبحث بأي منهما)
+DOCUMENT_TYPE_LABELS = {
+    'national_id': 'الهوية الوطنية',
+    'passport': 'جواز السفر',
+    'visa': 'التأشيرة',
+    'health_certificate': 'الشهادة الصحية',
+    'driving_license': 'رخصة القيادة',
+    'work_permit': 'تصريح العمل',
+    'education_certificate': 'الشهادة الدراسية',
+    'contract': 'عقد العمل',
+    'insurance': 'وثيقة التأمين',
+    'other': 'أخرى',
+}
+
+# التشكيل وعلامات القرآن والتطويل
+_DIACRITICS = re.compile('[\u0610-\u061a\u064b-\u065f\u0670\u06d6-\u06ed\u0640]')
+_LETTERS = str.maketrans({
+    'أ': 'ا', 'إ': 'ا', 'آ': 'ا', 'ٱ': 'ا',
+    'ة': 'ه', 'ى': 'ي', 'ؤ': 'و', 'ئ': 'ي',
+    **{chr(0x0660 + i): str(i) for i in range(10)},  # الأرقام الهندية
+    **{chr(0x06f0 + i): str(i) for i in range(10)},  # الأرقام الفارسية
+})
+_NON_WORD = re.compile(r'[\W_]+')
+
+# ثوانٍ بين إعادة فحص الفهرس النصي ما دام البحث على LIKE
+BACKEND_RECHECK = 300
+
+# الحالة في هذه العملية (تُحدد في ensure_schema أو عند أول بحث)
+_state = {'backend': None, 'checked_at': 0.0}
+_lock = threading.Lock()
+
+
+def normalize(value):
+    """
+    توحيد النص للفهرسة والبحث: أشكال الحروف العربية (NFKC)، حذف التشكيل والتطويل،
+    توحيد الهمزات والتاء المربوطة والألف المقصورة والأرقام، أحرف صغيرة، والرموز مسافات
+
+        normalize('إسْلام  أحمد-٣') == 'اسلام احمد 3'
+    """
+    if value is None:
+        return ''
+    result = unicodedata.normalize('NFKC', str(value))
+    result = _DIACRITICS.sub('', result).translate(_LETTERS).casefold()
+    return ' '.join(_NON_WORD.sub(' ', result).split())
+
+
+def _compact(value):
+    return normalize(value).replace(' ', '')
+
+
+# ---------------------------------------------------------------------------
+# محتوى الفهرس لكل نوع
+# ---------------------------------------------------------------------------
+
+def _document_type_text(document_type):
+    return f"{document_type or ''} {DOCUMENT_TYPE_LABELS.get(document_type, '')}"
+
+
+# النوع -> (النموذج، أعمدة المعرفات، أعمدة النص)
+ENTITIES = {
+    'employee': (Employee, ('employee_id', 'national_id', 'mobile'), ('name',)),
+    'vehicle': (Vehicle, ('plate_number',), ('make', 'model', 'color', 'driver_name')),
+    'document': (Document, ('document_number',), ('document_type',)),
+}
+
+
+def _entry(entity, values, extra=''):
+    """صف الفهرس من قيم الأعمدة {العمود: القيمة}"""
+    _, key_columns, text_columns = ENTITIES[entity]
+    keys = [_compact(values.get(column)) for column in key_columns]
+    keys = ' '.join(key for key in keys if key)
+    parts = [values.get(column) for column in text_columns]
+    if entity == 'document':
+        parts = [_document_type_text(values.get('document_type'))]
+    content = normalize(' '.join(str(part) for part in parts + [extra] if part))
+    return {'entity': entity, 'entity_id': values['id'], 'keys': keys,
+            'content': f"{content} {keys}".strip(), 'updated_at': datetime.utcnow()}
+
+
+def _indexed_columns(entity):
+    _, key_columns, text_columns = ENTITIES[entity]
+    columns = set(key_columns) | set(text_columns)
+    if entity == 'document':
+        columns.add('employee_id')
+    return columns
+
+
+def _employee_names(connection, employee_ids):
+    employee_ids = sorted({i for i in employee_ids if i is not None})
+    if not employee_ids:
+        return {}
+    table = Employee.__table__
+    return dict(connection.execute(select(table.c.id, table.c.name).where(table.c.id.in_(employee_ids))).all())
+
+
+def _document_rows(connection, values_list):
+    """صفوف فهرس الوثائق مع اسم الموظف صاحب الوثيقة"""
+    names = _employee_names(connection, [values.get('employee_id') for values in values_list])
+    return [_entry('document', values, names.get(values.get('employee_id'), '')) for values in values_list]
+
+
+# ---------------------------------------------------------------------------
+# الكتابة
+# ---------------------------------------------------------------------------
+
+def _upsert(connection, rows):
+    if not rows:
+        return
+    table = SearchEntry.__table__
+    dialect = connection.dialect.name
+    if dialect in ('postgresql', 'sqlite'):
+        stmt = (postgresql if dialect == 'postgresql' else sqlite).insert(table)
+        connection.execute(stmt.on_conflict_do_update(
+            index_elements=['entity', 'entity_id'],
+            set_={'keys': stmt.excluded['keys'], 'content': stmt.excluded.content,
+                  'updated_at': stmt.excluded.updated_at},
+        ), rows)
+        return
+    for entity in {row['entity'] for row in rows}:
+        entity_ids = [row['entity_id'] for row in rows if row['entity'] == entity]
+        connection.execute(delete(table).where(table.c.entity == entity, table.c.entity_id.in_(entity_ids)))
+    connection.execute(insert(table), rows)
+
+
+def _remove(connection, entity, entity_ids):
+    if entity_ids:
+        table = SearchEntry.__table__
+        connection.execute(delete(table).where(table.c.entity == entity, table.c.entity_id.in_(sorted(entity_ids))))
+
+
+def _changed(obj, columns):
+    state = inspect(obj)
+    return any(state.attrs[column].history.has_changes() for column in columns)
+
+
+def _values(obj, columns):
+    return {'id': obj.id, **{column: getattr(obj, column) for column in columns}}
+
+
+@event.listens_for(Session, 'after_flush')
+def _after_flush(session, flush_context):
+    models = {model: entity for entity, (model, _, _) in ENTITIES.items()}
+    upserts = {entity: {} for entity in ENTITIES}
+    removed = {entity: set() for entity in ENTITIES}
+    renamed_employees = set()
+
+    for obj in list(session.new) + list(session.dirty):
+        entity = models.get(type(obj))
+        if entity is None or obj.id is None:
+            continue
+        columns = _indexed_columns(entity)
+        if obj in session.new or _changed(obj, columns):
+            upserts[entity][obj.id] = _values(obj, columns)
+            if entity == 'employee' and obj not in session.new and _changed(obj, ('name',)):
+                renamed_employees.add(obj.id)
+    for obj in session.deleted:
+        entity = models.get(type(obj))
+        if entity is not None and obj.id is not None:
+            removed[entity].add(obj.id)
+            upserts[entity].pop(obj.id, None)
+
+    if not any(upserts.values()) and not any(removed.values()):
+        return
+    connection = session.connection()
+    try:
+        # نقطة حفظ: فشل أمر الفهرس يُلغى وحده، وإلا أبطل PostgreSQL المعاملة كلها بعده
+        with connection.begin_nested():
+            _write_changes(connection, upserts, removed, renamed_employees)
+    except Exception as e:
+        # الفهرس لا يُفشل حفظ البيانات الأصلية؛ flask search-index --rebuild يصلحه
+        logger.error(f"خطأ في تحديث فهرس البحث: {e}")
+
+
+def _write_changes(connection, upserts, removed, renamed_employees):
+    """كتابة تغييرات حفظ واحد في الفهرس"""
+    if renamed_employees:
+        # اسم الموظف جزء من نص وثائقه
+        table = Document.__table__
+        columns = sorted(_indexed_columns('document'))
+        for row in connection.execute(
+                select(table.c.id, *[table.c[c] for c in columns]).where(table.c.employee_id.in_(renamed_employees))):
+            upserts['document'].setdefault(row.id, dict(row._mapping))
+    rows = [_entry(entity, values) for entity in ('employee', 'vehicle') for values in upserts[entity].values()]
+    rows += _document_rows(connection, list(upserts['document'].values()))
+    _upsert(connection, rows)
+    for entity, entity_ids in removed.items():
+        _remove(connection, entity, entity_ids)
+
+
+def rebuild(entities=None, connection=None):
+    """
+    إعادة بناء فهرس الأنواع المحددة (الكل افتراضياً) من الجداول الأصلية
+
+    :return: {النوع: عدد الصفوف}
+    """
+    if connection is None:
+        with db.engine.begin() as connection:
+            return rebuild(entities, connection)
+
+    counts = {}
+    for entity in entities or ENTITIES:
+        model = ENTITIES[entity][0]
+        table = model.__table__
+        columns = sorted(_indexed_columns(entity))
+        _remove_all = delete(SearchEntry.__table__).where(SearchEntry.__table__.c.entity == entity)
+        connection.execute(_remove_all)
+        result = connection.execute(select(table.c.id, *[table.c[c] for c in columns]).order_by(table.c.id))
+        counts[entity] = 0
+        while True:
+            batch = [dict(row._mapping) for row in result.fetchmany(REBUILD_BATCH)]
+            if not batch:
+                break
+            if entity == 'document':
+                rows = _document_rows(connection, batch)
+            else:
+                rows = [_entry(entity, values) for values in batch]
+            connection.execute(insert(SearchEntry.__table__), rows)
+            counts[entity] += len(rows)
+    logger.info(f"أُعيد بناء فهرس البحث: {counts}")
+    return counts
+
+
+def status(connection=None):
+    """عدد صفوف الفهرس مقابل الجداول الأصلية لكل نوع، والفهرس النصي المستخدم"""
+    if connection is None:
+        with db.engine.connect() as connection:
+            return status(connection)
+    table = SearchEntry.__table__
+    indexed = dict(connection.execute(
+        select(table.c.entity, func.count()).group_by(table.c.entity)).all())
+    result = {'backend': _state['backend'] or _detect_backend(connection), 'entities': {}}
+    for entity, (model, _, _) in ENTITIES.items():
+        total = connection.execute(select(func.count()).select_from(model.__table__)).scalar()
+        result['entities'][entity] = {'rows': total, 'indexed': indexed.get(entity, 0)}
+    return result
+
+
+# ---------------------------------------------------------------------------
+# الفهرس النصي (FTS5 / pg_trgm)
+# ---------------------------------------------------------------------------
+
+_SQLITE_SCHEMA = (
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+    "keys, content, content='search_index', content_rowid='id', tokenize='trigram')",
+    f"CREATE TRIGGER IF NOT EXISTS search_index_ai AFTER INSERT ON search_index BEGIN "
+    f"INSERT INTO {FTS_TABLE}(rowid, keys, content) VALUES (new.id, new.keys, new.content); END",
+    f"CREATE TRIGGER IF NOT EXISTS search_index_ad AFTER DELETE ON search_index BEGIN "
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, keys, content) VALUES ('delete', old.id, old.keys, old.content); END",
+    f"CREATE TRIGGER IF NOT EXISTS search_index_au AFTER UPDATE ON search_index BEGIN "
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, keys, content) VALUES ('delete', old.id, old.keys, old.content); "
+    f"INSERT INTO {FTS_TABLE}(rowid, keys, content) VALUES (new.id, new.keys, new.content); END",
+)
+
+_POSTGRES_SCHEMA = (
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX IF NOT EXISTS ix_search_index_content_trgm ON search_index USING gin (content gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS ix_search_index_keys_trgm ON search_index USING gin (keys gin_trgm_ops)",
+)
+
+
+def _detect_backend(connection):
+    dialect = connection.dialect.name
+    if not ENABLED:
+        return 'like'
+    if dialect == 'sqlite':
+        exists = connection.execute(
+            text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"), {'name': FTS_TABLE}).first()
+        return 'fts5' if exists else 'like'
+    if dialect == 'postgresql':
+        exists = connection.execute(text("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")).first()
+        return 'pg_trgm' if exists else 'like'
+    return 'like'
+
+
+def ensure_schema(engine=None):
+    """
+    إنشاء الفهرس النصي إن لم يكن موجوداً، وبناء الفهرس أول مرة إذا كان فارغاً
+
+    :return: اسم الفهرس المستخدم: fts5 أو pg_trgm أو like
+    """
+    engine = engine or db.engine
+    dialect = engine.dialect.name
+    if ENABLED and dialect in ('sqlite', 'postgresql'):
+        try:
+            with engine.begin() as connection:
+                if dialect == 'sqlite':
+                    created = _detect_backend(connection) != 'fts5'
+                    for statement in _SQLITE_SCHEMA:
+                        connection.execute(text(statement))
+                    if created:
+                        connection.execute(text(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')"))
+                else:
+                    for statement in _POSTGRES_SCHEMA:
+                        connection.execute(text(statement))
+        except Exception as e:
+            # SQLite بدون FTS5 أو مجزئ trigram (أقدم من 3.34)، أو PostgreSQL بدون صلاحية CREATE EXTENSION
+            logger.warning(f"تعذر إنشاء الفهرس النصي للبحث، سيُستخدم LIKE: {e}")
+
+    with engine.begin() as connection:
+        empty = connection.execute(select(SearchEntry.__table__.c.id).limit(1)).first() is None
+        if empty and any(connection.execute(select(model.__table__.c.id).limit(1)).first()
+                         for model, _, _ in ENTITIES.values()):
+            rebuild(connection=connection)
+        backend = _detect_backend(connection)
+    _state['backend'] = backend
+    _state['checked_at'] = time.monotonic()
+    return backend
+
+
+def _backend():
+    backend = _state['backend']
+    # LIKE قد يعني أن مهمة القائد لم تنشئ الفهرس النصي بعد
+    stale = backend == 'like' and ENABLED and time.monotonic() - _state['checked_at'] >= BACKEND_RECHECK
+    if backend is None or stale:
+        with _lock:
+            if _state['backend'] == backend:
+                with db.engine.connect() as connection:
+                    _state['backend'] = _detect_backend(connection)
+                _state['checked_at'] = time.monotonic()
+    return _state['backend']
+
+
+# ---------------------------------------------------------------------------
+# البحث
+# ---------------------------------------------------------------------------
+
+def _trigrams(word):
+    padded = f"  {word} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def similarity(word, words):
+    """أعلى تشابه trigrams (0..1) بين word وأي كلمة من words"""
+    grams = _trigrams(word)
+    best = 0.0
+    for other in words:
+        other_grams = _trigrams(other)
+        best = max(best, len(grams & other_grams) / len(grams | other_grams))
+    return best
+
+
+def _score(tokens, compact, keys, content):
+    """درجة الصلة: 100 معرف مطابق، 90 بداية معرف، 80 جزء من معرف، 70 كلمة مطابقة، 60 بداية كلمة،
+    50 جزء من كلمة، وأقل من 40 للتطابق التقريبي"""
+    key_list = keys.split()
+    best = 0
+    if compact:
+        if compact in key_list:
+            best = 100
+        elif any(key.startswith(compact) for key in key_list):
+            best = 90
+        elif compact in keys:
+            best = 80
+    words = content.split()
+    scores = []
+    for token in tokens:
+        if token in words:
+            scores.append(70)
+        elif any(word.startswith(token) for word in words):
+            scores.append(60)
+        elif token in content:
+            scores.append(50)
+        else:
+            scores.append(40 * similarity(token, words))
+    return max(best, min(scores) if scores else 0)
+
+
+def _like(column, token):
+    escaped = token.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return column.like(f'%{escaped}%', escape='\\')
+
+
+def _fts_phrase(token):
+    return '"' + token.replace('"', '""') + '"'
+
+
+def _candidates(connection, entity, tokens, compact, keys_only):
+    """صفوف (المعرف، keys، content) التي تحتوي كل الكلمات أو المعرف المدمج"""
+    table = SearchEntry.__table__
+    columns = (table.c.entity_id, table.c['keys'], table.c.content)
+    searched = table.c['keys'] if keys_only else table.c.content
+    backend = _backend()
+
+    if backend == 'fts5' and len(compact) >= 3 and (keys_only or all(len(t) >= 3 for t in tokens)):
+        if keys_only:
+            match = f"keys : {_fts_phrase(compact)}"
+        else:
+            match = ' AND '.join(_fts_phrase(token) for token in tokens)
+            if len(tokens) > 1:
+                match = f"({match}) OR keys : {_fts_phrase(compact)}"
+        fts = text(f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH :match").bindparams(match=match)
+        query = select(*columns).where(table.c.entity == entity, table.c.id.in_(fts))
+    else:
+        condition = _like(table.c['keys'], compact) if keys_only else \
+            or_(db.and_(*[_like(searched, token) for token in tokens]), _like(table.c['keys'], compact))
+        query = select(*columns).where(table.c.entity == entity, condition)
+    return connection.execute(query).all()
+
+
+def _fuzzy_candidates(connection, entity, tokens, compact, keys_only):
+    """مرشحون للبحث التقريبي: يشتركون مع الكلمات في بعض الـ trigrams"""
+    table = SearchEntry.__table__
+    columns = (table.c.entity_id, table.c['keys'], table.c.content)
+    backend = _backend()
+    if backend == 'fts5':
+        grams = set()
+        for token in ([compact] if keys_only else tokens):
+            if len(token) >= 3:
+                grams |= {token[i:i + 3] for i in range(len(token) - 2)}
+        if not grams:
+            return []
+        prefix = 'keys : ' if keys_only else ''
+        match = prefix + '(' + ' OR '.join(_fts_phrase(gram) for gram in sorted(grams)) + ')'
+        fts = text(f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH :match ORDER BY rank LIMIT :limit") \
+            .bindparams(match=match, limit=FUZZY_CANDIDATES)
+        return connection.execute(select(*columns).where(table.c.entity == entity, table.c.id.in_(fts))).all()
+    if backend == 'pg_trgm':
+        phrase = compact if keys_only else ' '.join(tokens)
+        searched = table.c['keys'] if keys_only else table.c.content
+        query = (select(*columns)
+                 .where(table.c.entity == entity, searched.op('%>')(phrase))
+                 .order_by(func.word_similarity(phrase, searched).desc())
+                 .limit(FUZZY_CANDIDATES))
+        return connection.execute(query).all()
+    return []
+
+
+def search(entity, term, limit=50, keys_only=False, fuzzy=True):
+    """
+    البحث في نوع واحد (employee / vehicle / document) مرتباً حسب الصلة
+
+    :param keys_only: البحث في المعرفات فقط (مثل رقم اللوحة)
+    :param fuzzy: تجربة البحث التقريبي إذا لم تطابق أي نتيجة
+    :return: قائمة [(معرف السجل، الدرجة)] بحد أقصى limit (None بلا حد)
+    """
+    if entity not in ENTITIES:
+        raise ValueError(f"نوع بحث غير معروف: {entity}")
+    query = normalize(term)
+    tokens = query.split()
+    if not tokens:
+        return []
+    compact = query.replace(' ', '')
+    if keys_only:
+        tokens = [compact]
+
+    connection = db.session.connection()
+    rows = _candidates(connection, entity, tokens, compact, keys_only)
+    threshold = 0
+    if not rows and fuzzy:
+        rows = _fuzzy_candidates(connection, entity, tokens, compact, keys_only)
+        threshold = 40 * FUZZY_THRESHOLD
+
+    results = []
+    for entity_id, keys, content in rows:
+        score = _score(tokens, compact, keys, keys if keys_only else content)
+        if score >= threshold:
+            results.append((score, len(content), entity_id))
+    results.sort(key=lambda item: (-item[0], item[1], item[2]))
+    if limit is not None:
+        results = results[:limit]
+    return [(entity_id, round(score, 1)) for score, _, entity_id in results]
+
+
+def ids(entity, term, limit=None, keys_only=False, fuzzy=True):
+    """معرفات السجلات المطابقة مرتبة حسب الصلة"""
+    return [entity_id for entity_id, _ in search(entity, term, limit, keys_only, fuzzy)]
+
+
+def filter_query(query, entity, term, keys_only=False, fuzzy=True, order=True):
+    """
+    تقييد استعلام ORM على نموذج النوع بنتائج البحث
+
+    :param order: ترتيب النتائج حسب الصلة (يُضاف بعد أي ترتيب سابق في الاستعلام)
+    """
+    model = ENTITIES[entity][0]
+    matched = ids(entity, term, keys_only=keys_only, fuzzy=fuzzy)
+    if not matched:
+        return query.filter(false())
+    query = query.filter(model.id.in_(matched))
+    if order:
+        query = query.order_by(case({entity_id: rank for rank, entity_id in enumerate(matched)}, value=model.id))
+    return query
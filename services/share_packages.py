@@ -0,0 +1,388 @@
+"""
+حزم المشاركة للعمليات كملف ZIP يُبث مباشرة
+
+كان share_package ينسخ الصور إلى مجلد مؤقت في static/.temp، ويكتب ملف التفاصيل وملف
+Excel هناك، ثم يضغط المجلد كاملاً في ملف ZIP على القرص قبل إرسال أول بايت؛ فمشاركة
+تسليم بـ 200 صورة تنتظر نسخ الصور وضغطها كلها، وتترك نسختين منها على القرص. الآن:
+
+- stream() يكتب الأرشيف على دفعات (CHUNK_SIZE) مباشرة في الاستجابة: ملف التفاصيل
+  و Excel أولاً فيبدأ التنزيل فوراً، ثم كل مرفق يُقرأ من مكانه في التخزين (مجلدات الرفع،
+  المخزن المعتمد على المحتوى، أو نسخة Object Storage المحلية) دفعة بعد دفعة، وتقرير PDF
+  أخيراً. الذاكرة ثابتة مهما كان عدد الصور أو حجمها، ولا نسخ مؤقتة
+- المحتوى (manifest): نص التفاصيل و Excel ومسارات المرفقات، يُبنى مرة واحدة لكل إصدار
+  من العملية ويُحفظ في الذاكرة. الإصدار = updated_at للعملية مع ملفات إشارة لسجل
+  التسليم/الورشة والمركبة في instance/share_signals (كما في services.user_cache)، تُلمس
+  بعد commit أي تعديل على السجل أو صوره أو المركبة أو تسليماتها. إعادة المشاركة لا تنفذ
+  إذن إلا استعلام العملية نفسها
+"""
+import io
+import logging
+import os
+import threading
+import time
+import zipfile
+from collections import OrderedDict
+from datetime import datetime
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from app import db
+from models import Vehicle, VehicleHandover, VehicleHandoverImage, VehicleWorkshop, VehicleWorkshopImage
+
+logger = logging.getLogger(__name__)
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SIGNALS_DIR = os.path.join(PROJECT_ROOT, 'instance', 'share_signals')
+
+# مجلدات البحث عن المرفقات (بنفس ترتيب /uploads في app.py لمشاركة ذاكرة المسارات)
+UPLOAD_ROOTS = ('uploads', os.path.join('static', 'uploads'))
+
+CHUNK_SIZE = 64 * 1024
+# ضغط سريع: أغلب المرفقات صور مضغوطة أصلاً
+COMPRESS_LEVEL = 1
+MAX_MANIFESTS = 64
+
+OPERATION_TYPES = {
+    'handover': 'تسليم/استلام مركبة',
+    'workshop': 'ورشة صيانة',
+    'external_authorization': 'تفويض خارجي',
+    'safety_inspection': 'فحص سلامة'
+}
+
+_SESSION_KEY = 'share_package_changes'
+
+# معرف العملية -> {'version', 'details', 'excel', 'files', 'pdf'}
+_manifests = OrderedDict()
+_lock = threading.Lock()
+
+
+# ---------------------------------------------------------------------------
+# الإصدارات
+# ---------------------------------------------------------------------------
+
+def _signal_path(key):
+    return os.path.join(SIGNALS_DIR, key)
+
+
+def _mtime(key):
+    try:
+        return os.stat(_signal_path(key)).st_mtime_ns
+    except OSError:
+        return 0
+
+
+def _touch(key):
+    path = _signal_path(key)
+    now = time.time_ns()
+    try:
+        try:
+            os.utime(path, ns=(now, now))
+        except FileNotFoundError:
+            os.makedirs(SIGNALS_DIR, exist_ok=True)
+            open(path, 'a').close()
+            os.utime(path, ns=(now, now))
+    except OSError as e:
+        logger.warning(f"تعذر تحديث إشارة حزم المشاركة {path}: {e}")
+
+
+def _record_key(operation):
+    if operation.operation_type in ('handover', 'workshop') and operation.related_record_id:
+        return f"{operation.operation_type}-{operation.related_record_id}"
+    return None
+
+
+def version(operation):
+    """إصدار محتوى حزمة العملية (يتغير مع أي تعديل يظهر فيها)"""
+    record_key = _record_key(operation)
+    return (operation.updated_at, operation.vehicle_id, _mtime(f"vehicle-{operation.vehicle_id}"),
+            _mtime(record_key) if record_key else 0)
+
+
+def _keys_for(obj):
+    if isinstance(obj, VehicleHandover):
+        return (f"handover-{obj.id}", f"vehicle-{obj.vehicle_id}")
+    if isinstance(obj, VehicleHandoverImage):
+        return (f"handover-{obj.handover_record_id}",)
+    if isinstance(obj, VehicleWorkshop):
+        return (f"workshop-{obj.id}", f"vehicle-{obj.vehicle_id}")
+    if isinstance(obj, VehicleWorkshopImage):
+        return (f"workshop-{obj.workshop_record_id}",)
+    if isinstance(obj, Vehicle):
+        return (f"vehicle-{obj.id}",)
+    return ()
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_changes(session, flush_context):
+    changed = set()
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        changed.update(key for key in _keys_for(obj) if not key.endswith('-None'))
+    if changed:
+        session.info.setdefault(_SESSION_KEY, set()).update(changed)
+
+
+@event.listens_for(Session, 'after_commit')
+def _on_commit(session):
+    for key in session.info.pop(_SESSION_KEY, ()):
+        _touch(key)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _on_rollback(session):
+    session.info.pop(_SESSION_KEY, None)
+
+
+# ---------------------------------------------------------------------------
+# المحتوى
+# ---------------------------------------------------------------------------
+
+def resolve_attachment(stored_path, legacy_dir=None):
+    """
+    المسار المحلي لمرفق كما هو مخزن في قاعدة البيانات، أو None
+
+    يقبل الصيغ المخزنة: static/uploads/...، uploads/...، أو اسماً داخل legacy_dir
+    (مثل handover_images). الملفات الموجودة في Object Storage فقط تُنزّل مرة واحدة إلى
+    مجلد النسخ المحلية كما في تقديم /uploads.
+    """
+    from utils.file_serving import resolve_file
+    from utils.storage_helper import cache_object_locally
+
+    if not stored_path:
+        return None
+    name = stored_path.replace('\\', '/').lstrip('/')
+    if name.startswith('static/'):
+        name = name[len('static/'):]
+    if name.startswith('uploads/'):
+        name = name[len('uploads/'):]
+    candidates = [name] + ([f"{legacy_dir}/{name}"] if legacy_dir else [])
+    for candidate in candidates:
+        resolved = resolve_file(candidate, UPLOAD_ROOTS)
+        if resolved is not None:
+            return resolved[0]
+    cache_root = cache_object_locally(name)
+    if cache_root:
+        resolved = resolve_file(name, (cache_root,))
+        if resolved is not None:
+            return resolved[0]
+    return None
+
+
+def _details_text(operation, record, driver_name):
+    lines = ['═' * 50, f'          تفاصيل العملية #{operation.id}', '═' * 50, '',
+             f'نوع العملية: {OPERATION_TYPES.get(operation.operation_type, operation.operation_type)}',
+             f'الحالة: {operation.status}',
+             f'التاريخ: {operation.created_at.strftime("%Y/%m/%d %H:%M") if operation.created_at else ""}', '']
+
+    vehicle = operation.vehicle
+    if vehicle:
+        lines += ['─' * 50, 'معلومات المركبة:', '─' * 50,
+                  f'رقم اللوحة: {vehicle.plate_number}', f'النوع: {vehicle.make} {vehicle.model}']
+        if driver_name:
+            lines.append(f'السائق الحالي: {driver_name}')
+        lines.append('')
+
+    if isinstance(record, VehicleHandover):
+        lines += ['─' * 50, 'تفاصيل التسليم/الاستلام:', '─' * 50,
+                  f'النوع: {"تسليم" if record.handover_type == "delivery" else "استلام"}',
+                  f'اسم المستلم: {record.person_name}',
+                  f'المسافة المقطوعة: {record.mileage} كم']
+        if record.city:
+            lines.append(f'المدينة: {record.city}')
+        if record.project_name:
+            lines.append(f'المشروع: {record.project_name}')
+        if record.notes:
+            lines += ['', 'ملاحظات:', record.notes]
+        lines.append('')
+    elif isinstance(record, VehicleWorkshop):
+        lines += ['─' * 50, 'تفاصيل الورشة:', '─' * 50,
+                  f'السبب: {record.reason}',
+                  f'تاريخ الدخول: {record.entry_date.strftime("%Y/%m/%d")}']
+        if record.exit_date:
+            lines.append(f'تاريخ الخروج: {record.exit_date.strftime("%Y/%m/%d")}')
+        if record.notes:
+            lines += ['', 'ملاحظات:', record.notes]
+        lines.append('')
+
+    if operation.description:
+        lines += ['─' * 50, 'الوصف:', '─' * 50, operation.description, '']
+
+    lines += ['═' * 50, 'تم إنشاء هذا الملف من نظام نُظم لإدارة المركبات', '═' * 50]
+    return ('\n'.join(lines) + '\n').encode('utf-8')
+
+
+def _excel_bytes(operation):
+    from openpyxl import Workbook
+    from openpyxl.styles import Font
+
+    wb = Workbook()
+    ws = wb.active
+    ws.title = 'تفاصيل العملية'
+    ws.append(['البيان', 'القيمة'])
+    ws['A1'].font = Font(bold=True)
+    ws['B1'].font = Font(bold=True)
+    ws.append(['رقم العملية', f'#{operation.id}'])
+    ws.append(['نوع العملية', OPERATION_TYPES.get(operation.operation_type, operation.operation_type)])
+    if operation.vehicle:
+        ws.append(['رقم اللوحة', operation.vehicle.plate_number])
+    output = io.BytesIO()
+    wb.save(output)
+    return output.getvalue()
+
+
+def build_manifest(operation):
+    """
+    محتوى حزمة العملية (من الذاكرة إذا لم يتغير إصدارها)
+
+    :return: dict فيه details و excel (بايتات)، و files [(الاسم في الأرشيف، المسار المحلي)]،
+             و pdf معرف سجل التسليم لتقرير PDF أو None
+    """
+    current = version(operation)
+    with _lock:
+        cached = _manifests.get(operation.id)
+        if cached is not None and cached['version'] == current:
+            _manifests.move_to_end(operation.id)
+            return cached
+
+    record = None
+    images = []
+    if operation.operation_type == 'handover' and operation.related_record_id:
+        record = db.session.get(VehicleHandover, operation.related_record_id)
+        if record is not None:
+            images = [(image.get_path(), 'handover_images') for image in
+                      VehicleHandoverImage.query.filter_by(handover_record_id=record.id)
+                      .order_by(VehicleHandoverImage.id)]
+    elif operation.operation_type == 'workshop' and operation.related_record_id:
+        record = db.session.get(VehicleWorkshop, operation.related_record_id)
+        if record is not None:
+            images = [(image.image_path, 'workshop_images') for image in
+                      VehicleWorkshopImage.query.filter_by(workshop_record_id=record.id)
+                      .order_by(VehicleWorkshopImage.id)]
+
+    driver_name = None
+    if operation.vehicle:
+        driver_name = db.session.query(VehicleHandover.person_name).filter_by(
+            vehicle_id=operation.vehicle_id, handover_type='delivery'
+        ).order_by(VehicleHandover.handover_date.desc()).limit(1).scalar()
+
+    files = []
+    for stored_path, legacy_dir in images:
+        path = resolve_attachment(stored_path, legacy_dir)
+        if path is None:
+            logger.warning(f"مرفق غير موجود في حزمة العملية {operation.id}: {stored_path}")
+            continue
+        files.append((f'صورة_{len(files) + 1}_{os.path.basename(path)}', path))
+
+    try:
+        excel = _excel_bytes(operation)
+    except Exception as e:
+        logger.warning(f'فشل في إنشاء Excel لحزمة العملية {operation.id}: {e}')
+        excel = None
+
+    manifest = {
+        'version': current,
+        'details': _details_text(operation, record, driver_name),
+        'excel': excel,
+        'files': files,
+        'pdf': record.id if isinstance(record, VehicleHandover) else None,
+    }
+    with _lock:
+        _manifests[operation.id] = manifest
+        _manifests.move_to_end(operation.id)
+        while len(_manifests) > MAX_MANIFESTS:
+            _manifests.popitem(last=False)
+    return manifest
+
+
+# ---------------------------------------------------------------------------
+# البث
+# ---------------------------------------------------------------------------
+
+class _Sink:
+    """وجهة كتابة غير قابلة للتنقل (بدون seek/tell) يفرغها المولد بعد كل دفعة"""
+
+    def __init__(self):
+        self._parts = []
+        self.size = 0
+
+    def write(self, data):
+        if data:
+            self._parts.append(bytes(data))
+            self.size += len(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b''.join(self._parts)
+        self._parts = []
+        self.size = 0
+        return data
+
+
+def _handover_pdf(handover_id):
+    from utils.simple_pdf_generator import create_vehicle_handover_pdf
+
+    handover = db.session.get(VehicleHandover, handover_id)
+    if handover is None:
+        return None
+    result = create_vehicle_handover_pdf(handover)
+    return result.getvalue() if hasattr(result, 'getvalue') else result
+
+
+def _entries(operation, manifest):
+    """(الاسم، التاريخ، الحجم، دالة تعيد كائناً قابلاً للقراءة) لكل ملف بترتيب الأرشيف"""
+    now = datetime.now()
+    yield 'تفاصيل_العملية.txt', now, len(manifest['details']), lambda: io.BytesIO(manifest['details'])
+    if manifest['excel'] is not None:
+        yield (f'بيانات_العملية_{operation.id}.xlsx', now, len(manifest['excel']),
+               lambda: io.BytesIO(manifest['excel']))
+    for arcname, path in manifest['files']:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            logger.warning(f"المرفق لم يعد موجوداً: {path}")
+            continue
+        yield arcname, datetime.fromtimestamp(stat.st_mtime), stat.st_size, lambda path=path: open(path, 'rb')
+    if manifest['pdf'] is not None:
+        try:
+            pdf = _handover_pdf(manifest['pdf'])
+        except Exception as e:
+            logger.warning(f'فشل في إنشاء PDF لحزمة العملية {operation.id}: {e}')
+            pdf = None
+        if pdf:
+            yield f'تقرير_العملية_{operation.id}.pdf', now, len(pdf), lambda: io.BytesIO(pdf)
+
+
+def stream(operation):
+    """
+    مولد بايتات أرشيف ZIP لحزمة العملية (يُستخدم مع stream_with_context)
+
+    كل ملف يُقرأ ويُضغط على دفعات، ويُعاد ما تجمع من الأرشيف بعد كل دفعة.
+    """
+    manifest = build_manifest(operation)
+    sink = _Sink()
+    with zipfile.ZipFile(sink, 'w', zipfile.ZIP_DEFLATED, compresslevel=COMPRESS_LEVEL) as archive:
+        for arcname, modified, size, opener in _entries(operation, manifest):
+            try:
+                source = opener()
+            except OSError as e:
+                logger.warning(f"تعذر فتح المرفق {arcname}: {e}")
+                continue
+            with source:
+                info = zipfile.ZipInfo(arcname, date_time=modified.timetuple()[:6])
+                info.compress_type = zipfile.ZIP_DEFLATED
+                # الحجم المتوقع يحدد الحاجة إلى ZIP64 (الأرشيف يُكتب بدون رجوع لتعديل الترويسات)
+                info.file_size = size
+                with archive.open(info, 'w') as target:
+                    while True:
+                        chunk = source.read(CHUNK_SIZE)
+                        if not chunk:
+                            break
+                        target.write(chunk)
+                        if sink.size >= CHUNK_SIZE:
+                            yield sink.take()
+            if sink.size:
+                yield sink.take()
+    yield sink.take()
@@ -0,0 +1,230 @@
+"""
+لقطة التتبع المشتركة لصفحات التتبع
+
+صفحة التتبع في الجوال وصفحتا التتبع ولوحة التتبع في النظام كانت كل واحدة تنفذ استعلام
+ROW_NUMBER على كل employee_locations لكل زائر، ثم حلقة (كل دائرة جغرافية × كل موظف)
+بحساب haversine قيمة بقيمة. الآن تُبنى لقطة واحدة لكل عملية كل REFRESH_SECONDS ثوانٍ
+وتقرأها كل الصفحات:
+
+- آخر المواقع من services.live_locations (في الذاكرة، بدون استعلام على جدول المواقع)
+- الموظفون وأقسامهم والدوائر الجغرافية النشطة والمركبات المرتبطة بالمواقع باستعلامات قليلة
+- المسافات لكل (موظف، دائرة) محسوبة دفعة واحدة بـ numpy
+- التصنيف: نشط (موقع خلال ACTIVE_WINDOW) وغير نشط، ومن داخل كل دائرة (موقع خلال
+  GEOFENCE_WINDOW)، وأول دائرة تحتوي كل موظف
+
+العناصر كائنات بسيطة (SimpleNamespace) بنفس أسماء الحقول التي تستخدمها القوالب.
+"""
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+from sqlalchemy import select
+
+from app import db
+from services import live_locations
+from utils.lazy_imports import lazy_import
+
+np = lazy_import('numpy')
+
+logger = logging.getLogger(__name__)
+
+REFRESH_SECONDS = 5
+ACTIVE_WINDOW = timedelta(hours=1)
+GEOFENCE_WINDOW = timedelta(hours=24)
+EARTH_RADIUS_M = 6371000
+
+_lock = threading.Lock()
+_snapshot = None
+_built_at = 0.0
+
+
+def distances(latitudes, longitudes, center_latitudes, center_longitudes):
+    """مصفوفة المسافات بالأمتار (عدد النقاط × عدد المراكز) بصيغة haversine"""
+    lat1 = np.radians(np.asarray(latitudes, dtype=float))[:, None]
+    lon1 = np.radians(np.asarray(longitudes, dtype=float))[:, None]
+    lat2 = np.radians(np.asarray(center_latitudes, dtype=float))[None, :]
+    lon2 = np.radians(np.asarray(center_longitudes, dtype=float))[None, :]
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+
+def _load_employees():
+    from models import Department, Employee, employee_departments
+    employees = {}
+    for row in db.session.execute(
+            select(Employee.id, Employee.name, Employee.employee_id, Employee.profile_image, Employee.status)
+            .order_by(Employee.id)):
+        employees[row.id] = SimpleNamespace(
+            id=row.id, name=row.name, employee_id=row.employee_id, employee_number=row.employee_id,
+            profile_image=row.profile_image, photo_url=f"/{row.profile_image}" if row.profile_image else None,
+            status=row.status, departments=[], department=None)
+    for employee_id, department_id, name in db.session.execute(
+            select(employee_departments.c.employee_id, Department.id, Department.name)
+            .join(Department, Department.id == employee_departments.c.department_id)
+            .order_by(employee_departments.c.employee_id, Department.id)):
+        employee = employees.get(employee_id)
+        if employee is not None:
+            employee.departments.append(SimpleNamespace(id=department_id, name=name))
+    for employee in employees.values():
+        employee.department = employee.departments[0] if employee.departments else None
+    return employees
+
+
+def _load_geofences():
+    from models import Geofence
+    return [SimpleNamespace(id=gf.id, name=gf.name, center_latitude=float(gf.center_latitude),
+                            center_longitude=float(gf.center_longitude), radius_meters=gf.radius_meters,
+                            color=gf.color, department_id=gf.department_id)
+            for gf in Geofence.query.filter_by(is_active=True).order_by(Geofence.id).all()]
+
+
+def _load_vehicles(vehicle_ids):
+    from models import Vehicle
+    if not vehicle_ids:
+        return {}
+    return {row.id: SimpleNamespace(id=row.id, plate_number=row.plate_number, make=row.make, model=row.model)
+            for row in db.session.execute(
+                select(Vehicle.id, Vehicle.plate_number, Vehicle.make, Vehicle.model)
+                .where(Vehicle.id.in_(vehicle_ids)))}
+
+
+def build():
+    """بناء اللقطة من الذاكرة وقاعدة البيانات"""
+    now = datetime.utcnow()
+    positions, _ = live_locations.latest()
+    employees = _load_employees()
+    geofences = _load_geofences()
+
+    locations = {}
+    for employee_id, position in positions.items():
+        if employee_id not in employees:
+            continue
+        locations[employee_id] = SimpleNamespace(
+            latitude=position['latitude'], longitude=position['longitude'], recorded_at=position['recorded_at'],
+            vehicle_id=position['vehicle_id'], accuracy_m=position['accuracy_m'], speed_kmh=position['speed_kmh'])
+    vehicles = _load_vehicles({loc.vehicle_id for loc in locations.values() if loc.vehicle_id})
+
+    active_ids = [eid for eid in employees if eid in locations and locations[eid].recorded_at >= now - ACTIVE_WINDOW]
+    active = set(active_ids)
+    inactive_ids = [eid for eid in employees if eid not in active]
+
+    # المسافات لكل (موظف، دائرة) دفعة واحدة
+    inside = {gf.id: [] for gf in geofences}
+    first_geofence = {}
+    located_ids = list(locations)
+    if located_ids and geofences:
+        matrix = distances([locations[eid].latitude for eid in located_ids],
+                           [locations[eid].longitude for eid in located_ids],
+                           [gf.center_latitude for gf in geofences],
+                           [gf.center_longitude for gf in geofences])
+        within = matrix <= np.array([gf.radius_meters for gf in geofences], dtype=float)[None, :]
+        recent = np.array([locations[eid].recorded_at >= now - GEOFENCE_WINDOW for eid in located_ids])
+        for row, column in zip(*np.nonzero(within)):
+            employee_id = located_ids[row]
+            first_geofence.setdefault(employee_id, geofences[column])
+            if recent[row]:
+                inside[geofences[column].id].append((employee_id, float(matrix[row, column])))
+
+    return SimpleNamespace(
+        built_at=now,
+        employees=employees,
+        locations=locations,
+        vehicles=vehicles,
+        geofences=geofences,
+        active_ids=active_ids,
+        inactive_ids=inactive_ids,
+        inside=inside,
+        first_geofence=first_geofence,
+    )
+
+
+def current():
+    """اللقطة الحالية (تُعاد بناؤها إذا مر REFRESH_SECONDS على آخر بناء)"""
+    global _snapshot, _built_at
+    if _snapshot is not None and time.monotonic() - _built_at < REFRESH_SECONDS:
+        return _snapshot
+    with _lock:
+        if _snapshot is None or time.monotonic() - _built_at >= REFRESH_SECONDS:
+            started = time.monotonic()
+            _snapshot = build()
+            _built_at = time.monotonic()
+            logger.debug(f"لقطة التتبع: {len(_snapshot.employees)} موظف في {_built_at - started:.3f} ث")
+        return _snapshot
+
+
+def overview(snapshot=None):
+    """
+    بيانات صفحات التتبع (الجوال ولوحة التتبع): النشطون وغير النشطين ومن في كل دائرة ومن خارجها
+
+    :return: dict بمفاتيح القوالب (stats, employees_active, employees_inactive,
+             employees_by_geofence, employees_outside_geofences)
+    """
+    snapshot = snapshot or current()
+    employees, locations = snapshot.employees, snapshot.locations
+
+    active = []
+    with_vehicles = 0
+    for employee_id in snapshot.active_ids:
+        location = locations[employee_id]
+        vehicle = snapshot.vehicles.get(location.vehicle_id)
+        active.append({
+            'employee': employees[employee_id],
+            'location': location,
+            'departments': [d.name for d in employees[employee_id].departments],
+            'geofence': snapshot.first_geofence.get(employee_id),
+            'vehicle': vehicle,
+        })
+        if location.vehicle_id:
+            with_vehicles += 1
+
+    inside_any = set()
+    by_geofence = []
+    for geofence in snapshot.geofences:
+        members = [{'employee': employees[employee_id], 'location': locations[employee_id], 'distance': distance}
+                   for employee_id, distance in snapshot.inside[geofence.id]]
+        inside_any.update(employee_id for employee_id, _ in snapshot.inside[geofence.id])
+        by_geofence.append({'geofence': geofence, 'employees': members, 'count': len(members)})
+
+    outside = [{'employee': item['employee'], 'location': item['location']}
+               for item in active if item['employee'].id not in inside_any]
+
+    return {
+        'stats': {
+            'total_employees': len(employees),
+            'active_employees': len(active),
+            'inactive_employees': len(snapshot.inactive_ids),
+            'inside_geofences_count': len(inside_any),
+            'outside_geofences_count': len(outside),
+            'on_vehicles_count': with_vehicles,
+        },
+        'employees_active': active,
+        'employees_inactive': [employees[employee_id] for employee_id in snapshot.inactive_ids],
+        'employees_by_geofence': by_geofence,
+        'employees_outside_geofences': outside,
+    }
+
+
+def map_locations(snapshot=None, employee_ids=None):
+    """مواقع الخريطة {معرف الموظف كنص: بيانات} بنفس حالات services.live_locations"""
+    snapshot = snapshot or current()
+    now = datetime.utcnow()
+    result = {}
+    for employee_id in (snapshot.employees if employee_ids is None else employee_ids):
+        employee = snapshot.employees[employee_id]
+        location = snapshot.locations.get(employee_id)
+        if location is None:
+            result[str(employee_id)] = {'status': 'not_registered'}
+            continue
+        age_minutes = (now - location.recorded_at).total_seconds() / 60
+        result[str(employee_id)] = {
+            'latitude': location.latitude,
+            'longitude': location.longitude,
+            'name': employee.name,
+            'employee_id': employee.employee_id,
+            'status': live_locations.status_for(age_minutes),
+            'age_minutes': int(age_minutes),
+            'photo_url': employee.profile_image,
+        }
+    return result
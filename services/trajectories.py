@@ -0,0 +1,320 @@
+"""
+محرك مسارات الموظفين: رحلات ووقفات وهندسة مبسطة لكل موظف في كل يوم
+
+صفحة سجل التحركات وتصديراتها (PDF و Excel) كانت تحمّل كل نقاط آخر 24 ساعة ككائنات ORM
+(مع تحميل loc.vehicle لكل نقطة) وترسلها كلها للمتصفح. الآن:
+
+- نقاط اليوم (UTC) تُقرأ أعمدةً باستعلام واحد، والمسافات والسرعات بين النقاط المتتالية
+  تُحسب دفعة واحدة بـ numpy
+- الوقفات: نقاط متتالية ضمن STOP_RADIUS_M من أول نقطة فيها لمدة STOP_MIN_SECONDS على الأقل.
+  الرحلات: ما بين الوقفات، وتنقطع عند انقطاع الإشارة أكثر من MAX_GAP_SECONDS
+- هندسة كل رحلة مبسطة بـ Douglas–Peucker بتسامح يناسب كل مستوى تكبير في ZOOM_LEVELS
+  (تمريرة واحدة تحسب أهمية كل نقطة، ثم كل مستوى يأخذ النقاط التي تتجاوز تسامحه)
+- ملخص اليوم يُحفظ في ذاكرة العملية حسب (الموظف، اليوم) ويُعاد بناؤه فقط إذا تغير عدد
+  نقاط اليوم أو آخر معرف فيها
+
+recent() تجمع ملخصات الأيام التي تغطي آخر N ساعة للصفحة والتصديرات.
+"""
+import logging
+import math
+import threading
+from collections import OrderedDict
+from datetime import datetime, time as dt_time, timedelta
+
+from sqlalchemy import func, select
+
+from app import db
+from models import EmployeeLocation, Vehicle
+from utils.lazy_imports import lazy_import
+
+np = lazy_import('numpy')
+
+logger = logging.getLogger(__name__)
+
+EARTH_RADIUS_M = 6371000
+STOP_RADIUS_M = 75
+STOP_MIN_SECONDS = 5 * 60
+MAX_GAP_SECONDS = 15 * 60
+WALKING_SPEED_KMH = 10
+# مستويات التكبير التي تُحفظ لها هندسة مبسطة، والتسامح بالبكسل عند كل مستوى
+ZOOM_LEVELS = (10, 13, 16)
+TOLERANCE_PIXELS = 1.5
+CACHE_SIZE = 256
+_STAY_CHUNK = 64
+
+# (معرف الموظف، اليوم) -> (النسخة، الملخص)
+_cache = OrderedDict()
+_lock = threading.Lock()
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    """المسافة بالأمتار بين نقاط (مصفوفات numpy أو أرقام، مع البث)"""
+    lat1, lon1, lat2, lon2 = (np.radians(v) for v in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+def tolerance_m(zoom, latitude):
+    """التسامح بالأمتار عند مستوى التكبير (عرض TOLERANCE_PIXELS بكسل على خرائط الويب)"""
+    return TOLERANCE_PIXELS * 156543.03 * math.cos(math.radians(latitude)) / (2 ** zoom)
+
+
+def significance(lat, lon):
+    """
+    أهمية كل نقطة في Douglas–Peucker: أكبر تسامح تبقى عنده النقطة
+
+    التبسيط بأي تسامح = النقاط التي أهميتها أكبر منه (والطرفان دائماً).
+    """
+    n = len(lat)
+    sig = np.zeros(n)
+    if n == 0:
+        return sig
+    sig[0] = sig[-1] = np.inf
+    # إسقاط محلي بالأمتار حول متوسط خط العرض
+    scale = math.cos(math.radians(float(np.mean(lat))))
+    x = np.radians(lon) * EARTH_RADIUS_M * scale
+    y = np.radians(lat) * EARTH_RADIUS_M
+    stack = [(0, n - 1, np.inf)]
+    while stack:
+        first, last, parent = stack.pop()
+        if last - first < 2:
+            continue
+        px, py = x[first + 1:last], y[first + 1:last]
+        dx, dy = x[last] - x[first], y[last] - y[first]
+        length = math.hypot(dx, dy)
+        if length == 0:
+            dist = np.hypot(px - x[first], py - y[first])
+        else:
+            dist = np.abs(dy * (px - x[first]) - dx * (py - y[first])) / length
+        k = int(np.argmax(dist))
+        d = min(float(dist[k]), parent)
+        index = first + 1 + k
+        sig[index] = d
+        stack.append((first, index, d))
+        stack.append((index, last, d))
+    return sig
+
+
+def simplify(lat, lon):
+    """{مستوى التكبير: [[lat, lon], ...]} للهندسة المبسطة"""
+    sig = significance(lat, lon)
+    middle = float(np.mean(lat)) if len(lat) else 0.0
+    geometry = {}
+    for zoom in ZOOM_LEVELS:
+        keep = sig > tolerance_m(zoom, middle)
+        geometry[zoom] = [[round(float(a), 6), round(float(b), 6)] for a, b in zip(lat[keep], lon[keep])]
+    return geometry
+
+
+def _load(employee_id, start, end):
+    rows = db.session.execute(
+        select(EmployeeLocation.latitude, EmployeeLocation.longitude, EmployeeLocation.recorded_at,
+               EmployeeLocation.speed_kmh, EmployeeLocation.vehicle_id)
+        .where(EmployeeLocation.employee_id == employee_id,
+               EmployeeLocation.recorded_at >= start, EmployeeLocation.recorded_at < end)
+        .order_by(EmployeeLocation.recorded_at, EmployeeLocation.id)).all()
+    times = [row.recorded_at for row in rows]
+    lat = np.array([float(row.latitude) for row in rows])
+    lon = np.array([float(row.longitude) for row in rows])
+    speed = np.array([float(row.speed_kmh) if row.speed_kmh is not None else np.nan for row in rows])
+    vehicle = np.array([row.vehicle_id or 0 for row in rows], dtype=np.int64)
+    return times, lat, lon, speed, vehicle
+
+
+def _stay_end(i, lat, lon):
+    """أول نقطة بعد i تبعد أكثر من STOP_RADIUS_M عن النقطة i (أو n)"""
+    n = len(lat)
+    j = i + 1
+    while j < n:
+        stop = min(n, j + _STAY_CHUNK)
+        far = np.flatnonzero(haversine(lat[i], lon[i], lat[j:stop], lon[j:stop]) > STOP_RADIUS_M)
+        if far.size:
+            return j + int(far[0])
+        j = stop
+    return n
+
+
+def segment(seconds, lat, lon):
+    """
+    تقسيم النقاط إلى وقفات ورحلات
+
+    :return: (الوقفات [(أول، آخر)]، الرحلات [(أول، آخر، أول نقطة خاصة، آخر نقطة خاصة)])
+             الرحلة تبدأ من آخر نقطة في الوقفة السابقة وتنتهي بأول نقطة في التالية
+             حتى يتصل المسار، ونقاطها الخاصة هي ما بين الوقفتين
+    """
+    n = len(seconds)
+    stop_of = np.full(n, -1)
+    stops = []
+    i = 0
+    while i < n:
+        j = _stay_end(i, lat, lon)
+        if j - 1 > i and seconds[j - 1] - seconds[i] >= STOP_MIN_SECONDS:
+            stop_of[i:j] = len(stops)
+            stops.append((i, j - 1))
+            i = j
+        else:
+            i += 1
+
+    gap = np.zeros(n, dtype=bool)
+    gap[1:] = np.diff(seconds) > MAX_GAP_SECONDS
+
+    trips = []
+    i = 0
+    while i < n:
+        if stop_of[i] >= 0:
+            last = stops[stop_of[i]][1]
+            # انتقال مباشر من وقفة إلى التي تليها
+            if last + 1 < n and stop_of[last + 1] >= 0 and not gap[last + 1]:
+                trips.append((last, last + 1, last + 1, last))
+            i = last + 1
+            continue
+        own_first = i
+        while i + 1 < n and stop_of[i + 1] < 0 and not gap[i + 1]:
+            i += 1
+        own_last = i
+        first = own_first - 1 if own_first > 0 and stop_of[own_first - 1] >= 0 and not gap[own_first] else own_first
+        last = own_last + 1 if own_last + 1 < n and stop_of[own_last + 1] >= 0 and not gap[own_last + 1] else own_last
+        if last > first:
+            trips.append((first, last, own_first, own_last))
+        i += 1
+    return stops, trips
+
+
+def _vehicles(ids):
+    if not ids:
+        return {}
+    return {row.id: {'id': row.id, 'plate_number': row.plate_number, 'make': row.make, 'model': row.model}
+            for row in db.session.execute(
+                select(Vehicle.id, Vehicle.plate_number, Vehicle.make, Vehicle.model).where(Vehicle.id.in_(ids)))}
+
+
+def build(employee_id, day):
+    """ملخص يوم واحد (UTC) لموظف: الرحلات والوقفات والإحصائيات"""
+    start = datetime.combine(day, dt_time.min)
+    times, lat, lon, speed, vehicle = _load(employee_id, start, start + timedelta(days=1))
+    n = len(times)
+    seconds = np.array([(t - start).total_seconds() for t in times])
+
+    step = np.zeros(n)
+    derived = np.zeros(n)
+    if n > 1:
+        step[1:] = haversine(lat[:-1], lon[:-1], lat[1:], lon[1:])
+        dt = np.diff(seconds)
+        derived[1:] = np.divide(step[1:], dt, out=np.zeros(n - 1), where=dt > 0) * 3.6
+    # السرعة المسجلة من الجهاز إن وُجدت، وإلا المحسوبة من المسافة والزمن
+    speed = np.where(np.isnan(speed), derived, speed)
+
+    stops, trips = segment(seconds, lat, lon)
+
+    stop_items = []
+    for first, last in stops:
+        stop_items.append({
+            'start': times[first],
+            'end': times[last],
+            'duration_minutes': round((seconds[last] - seconds[first]) / 60, 1),
+            'latitude': round(float(lat[first:last + 1].mean()), 6),
+            'longitude': round(float(lon[first:last + 1].mean()), 6),
+            'points': last - first + 1,
+            'vehicle_points': int(np.count_nonzero(vehicle[first:last + 1])),
+        })
+
+    trip_items = []
+    for first, last, own_first, own_last in trips:
+        span = slice(first, last + 1)
+        distance = float(step[first + 1:last + 1].sum())
+        duration = float(seconds[last] - seconds[first])
+        avg_speed = distance / duration * 3.6 if duration > 0 else 0.0
+        vehicles = vehicle[span][vehicle[span] > 0]
+        vehicle_id = int(np.bincount(vehicles).argmax()) if vehicles.size else None
+        trip_items.append({
+            'start': times[first],
+            'end': times[last],
+            'distance_km': round(distance / 1000, 3),
+            'duration_minutes': round(duration / 60, 1),
+            'avg_speed': round(avg_speed, 1),
+            'max_speed': round(float(speed[span].max()), 1),
+            'mode': 'driving' if avg_speed >= WALKING_SPEED_KMH or vehicle_id else 'walking',
+            'vehicle_id': vehicle_id,
+            'points': max(own_last - own_first + 1, 0),
+            'vehicle_points': int(np.count_nonzero(vehicle[own_first:own_last + 1])),
+            'geometry': simplify(lat[span], lon[span]),
+        })
+
+    return {
+        'day': day,
+        'points': n,
+        'trips': trip_items,
+        'stops': stop_items,
+        'vehicles': _vehicles({trip['vehicle_id'] for trip in trip_items if trip['vehicle_id']}),
+    }
+
+
+def _version(employee_id, day):
+    start = datetime.combine(day, dt_time.min)
+    return tuple(db.session.execute(
+        select(func.count(EmployeeLocation.id), func.max(EmployeeLocation.id))
+        .where(EmployeeLocation.employee_id == employee_id,
+               EmployeeLocation.recorded_at >= start,
+               EmployeeLocation.recorded_at < start + timedelta(days=1))).one())
+
+
+def day_summary(employee_id, day):
+    """ملخص اليوم من الذاكرة، يُعاد بناؤه إذا تغيرت نقاط اليوم"""
+    key = (employee_id, day)
+    version = _version(employee_id, day)
+    with _lock:
+        cached = _cache.get(key)
+        if cached is not None and cached[0] == version:
+            _cache.move_to_end(key)
+            return cached[1]
+    summary = build(employee_id, day)
+    with _lock:
+        _cache[key] = (version, summary)
+        _cache.move_to_end(key)
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+    logger.debug(f"مسار الموظف {employee_id} ليوم {day}: {summary['points']} نقطة، "
+                 f"{len(summary['trips'])} رحلة، {len(summary['stops'])} وقفة")
+    return summary
+
+
+def recent(employee_id, hours=24, now=None):
+    """
+    الرحلات والوقفات التي انتهت خلال آخر hours ساعة، مع إحصائياتها
+
+    :return: dict فيه trips و stops (بترتيب زمني) و vehicles و stats
+             (points, distance_km, max_speed, vehicle_points, moving_minutes, stopped_minutes)
+    """
+    now = now or datetime.utcnow()
+    cutoff = now - timedelta(hours=hours)
+    trips, stops, vehicles = [], [], {}
+    day = cutoff.date()
+    while day <= now.date():
+        summary = day_summary(employee_id, day)
+        trips.extend(trip for trip in summary['trips'] if trip['end'] >= cutoff)
+        stops.extend(stop for stop in summary['stops'] if stop['end'] >= cutoff)
+        vehicles.update(summary['vehicles'])
+        day += timedelta(days=1)
+
+    items = trips + stops
+    return {
+        'trips': trips,
+        'stops': stops,
+        'vehicles': vehicles,
+        'stats': {
+            'points': sum(item['points'] for item in items),
+            'distance_km': round(sum(trip['distance_km'] for trip in trips), 2),
+            'max_speed': max((trip['max_speed'] for trip in trips), default=0.0),
+            'vehicle_points': sum(item['vehicle_points'] for item in items),
+            'moving_minutes': round(sum(trip['duration_minutes'] for trip in trips)),
+            'stopped_minutes': round(sum(stop['duration_minutes'] for stop in stops)),
+        },
+    }
+
+
+def timeline(history):
+    """الرحلات والوقفات معاً مرتبة زمنياً، كل عنصر مع kind ('trip' أو 'stop')"""
+    items = [dict(trip, kind='trip') for trip in history['trips']]
+    items += [dict(stop, kind='stop') for stop in history['stops']]
+    items.sort(key=lambda item: item['start'])
+    return items
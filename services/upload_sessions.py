@@ -0,0 +1,349 @@
+"""
+جلسات الرفع المجزأ القابلة للاستئناف
+
+يُرفع الملف الكبير على دفعات (chunks) بطلبات PUT متتالية، كل دفعة تُكتب مباشرة
+من تدفق الطلب إلى ملف جزئي على القرص مع تحديث البصمة تدريجياً، فلا يُحمَّل الملف
+في ذاكرة العامل مهما كان حجمه. عند انقطاع الاتصال يسأل التطبيق عن الإزاحة الحالية
+ويكمل من حيث توقف. عند الإكمال يُنقل الملف إلى مخزن الملفات (BlobStore) دون نسخه.
+
+    POST   /mobile/uploads                 بدء جلسة   {filename, size, sha256?}
+    GET    /mobile/uploads/<id>            الإزاحة الحالية للاستئناف
+    PUT    /mobile/uploads/<id>            رفع دفعة (ترويسة Upload-Offset)
+    POST   /mobile/uploads/<id>/complete   إنهاء الرفع والحصول على المسار
+
+الدفعات المتزامنة لنفس الرفع (إعادة محاولة أثناء بقاء الطلب الأول، أو عاملان مختلفان)
+تُنفذ واحدة تلو الأخرى بقفل ملف لكل جلسة. ملفات الجلسة المستلمة (claim_uploads) تُحذف
+بعد حفظ معاملة الطلب فقط، فإذا فشل حفظ النموذج يعيد التطبيق إرساله بنفس المعرفات.
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from werkzeug.utils import secure_filename
+
+from app import db
+from services.blob_store import BlobStore, CHUNK_SIZE, hash_file
+
+logger = logging.getLogger(__name__)
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SESSIONS_DIR = os.path.join(PROJECT_ROOT, 'instance', 'upload_sessions')
+
+# الحد الأقصى لحجم الملف الواحد ولحجم الدفعة الواحدة
+MAX_FILE_SIZE = int(os.environ.get('UPLOAD_MAX_FILE_SIZE', 200 * 1024 * 1024))
+MAX_CHUNK_SIZE = 8 * 1024 * 1024
+RECOMMENDED_CHUNK_SIZE = 2 * 1024 * 1024
+
+# الجلسات غير المكتملة تُحذف بعد هذه المدة
+SESSION_TTL = 24 * 3600
+
+# البصمة التدريجية لكل جلسة في هذه العملية: upload_id -> (الإزاحة, كائن hashlib)
+_hashers = {}
+_hashers_lock = threading.Lock()
+_last_cleanup = 0.0
+
+# ملفات الجلسات المستلمة في معاملة الجلسة الحالية، تُحذف بعد حفظها
+_SESSION_KEY = 'upload_sessions_claimed'
+
+
+class UploadError(Exception):
+    """خطأ في جلسة الرفع مع رمز HTTP المناسب"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+class UploadTooLarge(UploadError):
+    def __init__(self, message='حجم الملف يتجاوز الحد المسموح'):
+        super().__init__(message, 413)
+
+
+def copy_stream(source, out, limit=None, hasher=None):
+    """
+    نسخ تدفق إلى ملف على دفعات مع حد أقصى اختياري وتحديث البصمة
+
+    :return: عدد البايتات المكتوبة
+    :raises UploadTooLarge: عند تجاوز الحد
+    """
+    written = 0
+    while True:
+        chunk = source.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        written += len(chunk)
+        if limit is not None and written > limit:
+            raise UploadTooLarge()
+        if hasher is not None:
+            hasher.update(chunk)
+        out.write(chunk)
+    return written
+
+
+def _paths(upload_id):
+    # المعرف يأتي من المستخدم؛ hex فقط حتى لا يخرج المسار من المجلد
+    if not upload_id or len(upload_id) != 32 or any(c not in '0123456789abcdef' for c in upload_id):
+        raise UploadError('معرف الرفع غير صحيح', 404)
+    base = os.path.join(SESSIONS_DIR, upload_id)
+    return f"{base}.json", f"{base}.part"
+
+
+def _load(upload_id):
+    meta_path, part_path = _paths(upload_id)
+    try:
+        with open(meta_path, encoding='utf-8') as f:
+            meta = json.load(f)
+    except FileNotFoundError:
+        raise UploadError('جلسة الرفع غير موجودة أو منتهية', 404)
+    return meta, meta_path, part_path
+
+
+def _lock_path(upload_id):
+    meta_path, _ = _paths(upload_id)
+    return f"{meta_path[:-len('.json')]}.lock"
+
+
+@contextmanager
+def _locked(upload_id):
+    """قفل حصري لجلسة رفع بين الخيوط والعمليات (flock على ملف .lock بجانب الجلسة)"""
+    try:
+        import fcntl
+    except ImportError:
+        # بدون flock (Windows) تُفترض عملية واحدة
+        yield
+        return
+    with open(_lock_path(upload_id), 'a') as handle:
+        fcntl.flock(handle, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(handle, fcntl.LOCK_UN)
+
+
+def _remove_files(paths):
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning(f"تعذر حذف ملف جلسة الرفع {path}: {e}")
+
+
+def _save_meta(meta_path, meta):
+    tmp_path = f"{meta_path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(meta, f)
+    os.replace(tmp_path, meta_path)
+
+
+def _check_owner(meta, user_id):
+    if meta.get('user_id') != user_id:
+        raise UploadError('جلسة الرفع غير موجودة أو منتهية', 404)
+
+
+def _current_offset(part_path):
+    try:
+        return os.path.getsize(part_path)
+    except OSError:
+        return 0
+
+
+def cleanup_stale_sessions(max_age=SESSION_TTL):
+    """حذف الجلسات غير المكتملة الأقدم من المدة المحددة (ملفات مؤقتة خارج uploads)"""
+    global _last_cleanup
+    now = time.time()
+    _last_cleanup = now
+    if not os.path.isdir(SESSIONS_DIR):
+        return 0
+    removed = 0
+    for name in os.listdir(SESSIONS_DIR):
+        path = os.path.join(SESSIONS_DIR, name)
+        try:
+            if now - os.path.getmtime(path) > max_age:
+                os.remove(path)
+                removed += 1
+        except OSError:
+            continue
+    return removed
+
+
+def start_upload(user_id, filename, size, sha256=None):
+    """
+    بدء جلسة رفع جديدة
+
+    :param user_id: مالك الجلسة
+    :param filename: اسم الملف الأصلي (لتحديد الامتداد)
+    :param size: الحجم الكامل المعلن بالبايت
+    :param sha256: البصمة المتوقعة (اختيارية) للتحقق عند الإكمال
+    """
+    if time.time() - _last_cleanup > 600:
+        cleanup_stale_sessions()
+
+    try:
+        size = int(size)
+    except (TypeError, ValueError):
+        raise UploadError('حجم الملف مطلوب')
+    if size <= 0:
+        raise UploadError('الملف فارغ')
+    if size > MAX_FILE_SIZE:
+        raise UploadTooLarge()
+
+    os.makedirs(SESSIONS_DIR, exist_ok=True)
+    upload_id = uuid.uuid4().hex
+    meta_path, part_path = _paths(upload_id)
+    meta = {
+        'upload_id': upload_id,
+        'user_id': user_id,
+        'filename': secure_filename(filename or '') or 'file.bin',
+        'size': size,
+        'sha256': (sha256 or '').lower() or None,
+        'created_at': time.time(),
+        'result': None,
+    }
+    open(part_path, 'wb').close()
+    _save_meta(meta_path, meta)
+    with _hashers_lock:
+        _hashers[upload_id] = (0, hashlib.sha256())
+    return {'upload_id': upload_id, 'offset': 0, 'chunk_size': RECOMMENDED_CHUNK_SIZE,
+            'max_chunk_size': MAX_CHUNK_SIZE}
+
+
+def upload_status(upload_id, user_id):
+    """الإزاحة الحالية (عدد البايتات المستلمة) لاستئناف الرفع"""
+    meta, _, part_path = _load(upload_id)
+    _check_owner(meta, user_id)
+    return {'upload_id': upload_id, 'offset': _current_offset(part_path), 'size': meta['size'],
+            'completed': bool(meta.get('result'))}
+
+
+def append_chunk(upload_id, user_id, offset, stream, content_length=None):
+    """
+    كتابة دفعة من تدفق الطلب مباشرة إلى نهاية الملف الجزئي
+
+    :param offset: الإزاحة التي يعتقد العميل أنها الحالية؛ يجب أن تطابق حجم الملف الجزئي
+    :param stream: تدفق جسم الطلب (request.stream)
+    :return: الإزاحة الجديدة
+    """
+    meta, _, part_path = _load(upload_id)
+    _check_owner(meta, user_id)
+    with _locked(upload_id):
+        # إعادة القراءة بعد القفل: قد يكون طلب سابق أكمل الرفع أثناء الانتظار
+        meta, _, part_path = _load(upload_id)
+        if meta.get('result'):
+            raise UploadError('تم إكمال هذا الرفع مسبقاً', 409)
+
+        current = _current_offset(part_path)
+        if offset != current:
+            # العميل يعيد المحاولة من إزاحة خاطئة: يُعاد له الصحيح ليستأنف منه
+            raise UploadError(f'الإزاحة غير متطابقة، الإزاحة الحالية {current}', 409)
+
+        remaining = meta['size'] - current
+        if content_length is not None and (content_length > MAX_CHUNK_SIZE or content_length > remaining):
+            raise UploadTooLarge('حجم الدفعة يتجاوز الحد المسموح')
+
+        with _hashers_lock:
+            hasher_offset, hasher = _hashers.get(upload_id, (None, None))
+        if hasher_offset != current:
+            # الدفعات السابقة وصلت إلى عامل آخر؛ البصمة تُحسب من القرص عند الإكمال
+            hasher = None
+
+        with open(part_path, 'ab') as out:
+            try:
+                written = copy_stream(stream, out, limit=min(MAX_CHUNK_SIZE, remaining), hasher=hasher)
+            except UploadTooLarge:
+                out.truncate(current)
+                with _hashers_lock:
+                    _hashers.pop(upload_id, None)
+                raise
+
+        new_offset = current + written
+        with _hashers_lock:
+            if hasher is not None:
+                _hashers[upload_id] = (new_offset, hasher)
+            else:
+                _hashers.pop(upload_id, None)
+        return new_offset
+
+
+def complete_upload(upload_id, user_id):
+    """
+    التحقق من اكتمال الملف ونقله إلى مخزن الملفات
+
+    :return: {'path': المسار النسبي، 'file_type': 'image' أو 'pdf' أو 'file', 'created': bool}
+    """
+    meta, meta_path, part_path = _load(upload_id)
+    _check_owner(meta, user_id)
+    with _locked(upload_id):
+        meta, meta_path, part_path = _load(upload_id)
+        if meta.get('result'):
+            return meta['result']
+
+        size = _current_offset(part_path)
+        if size != meta['size']:
+            raise UploadError(f"الملف غير مكتمل ({size} من {meta['size']})", 409)
+
+        with _hashers_lock:
+            hasher_offset, hasher = _hashers.pop(upload_id, (None, None))
+        digest = hasher.hexdigest() if hasher is not None and hasher_offset == size else hash_file(part_path)
+        if meta.get('sha256') and meta['sha256'] != digest:
+            os.remove(part_path)
+            os.remove(meta_path)
+            raise UploadError('بصمة الملف لا تطابق الملف المرسل، يرجى إعادة الرفع', 422)
+
+        ext = meta['filename'].rsplit('.', 1)[-1].lower() if '.' in meta['filename'] else ''
+        file_type = 'pdf' if ext == 'pdf' else ('image' if ext in BlobStore.IMAGE_EXTENSIONS else 'file')
+        # الصورة تُحسّن قبل نقلها للمخزن (بصمة جديدة للناتج) وتُجدول نسخها المصغرة في الخلفية
+        if file_type == 'image':
+            path, created = BlobStore.ingest_image(part_path, meta['filename'])
+        else:
+            path, created = BlobStore.ingest(part_path, digest, size, meta['filename'])
+
+        meta['result'] = {'path': path, 'file_type': file_type, 'created': created,
+                          'filename': meta['filename']}
+        _save_meta(meta_path, meta)
+        return meta['result']
+
+
+def claim_uploads(upload_ids, user_id):
+    """
+    استلام نتائج جلسات مكتملة لإرفاقها بسجل (تسليم، فحص...) ثم إنهاء الجلسات
+
+    ملفات الجلسات تُحذف بعد حفظ معاملة الطلب (db.session)، وتبقى إذا تراجع عنها.
+
+    :return: قائمة نتائج complete_upload بنفس الترتيب (الجلسات غير الصالحة تُتجاهل)
+    """
+    results = []
+    claimed = db.session.info.setdefault(_SESSION_KEY, [])
+    for upload_id in upload_ids:
+        try:
+            meta, meta_path, part_path = _load(upload_id)
+            _check_owner(meta, user_id)
+        except UploadError as e:
+            logger.warning(f"تجاهل جلسة رفع غير صالحة {upload_id}: {e}")
+            continue
+        if not meta.get('result'):
+            logger.warning(f"تجاهل جلسة رفع غير مكتملة {upload_id}")
+            continue
+        results.append(meta['result'])
+        claimed.extend((meta_path, part_path, _lock_path(upload_id)))
+    return results
+
+
+@event.listens_for(Session, 'after_commit')
+def _on_commit(session):
+    _remove_files(session.info.pop(_SESSION_KEY, ()))
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _on_rollback(session, previous_transaction):
+    # التراجع عن نقطة حفظ داخلية لا يلغي الاستلام
+    if previous_transaction.parent is None:
+        session.info.pop(_SESSION_KEY, None)
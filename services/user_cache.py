@@ -0,0 +1,298 @@
+"""
+ذاكرة المستخدمين وصلاحياتهم بين الطلبات
+
+كان load_user ينفذ User.query.get في كل طلب، وكانت get_user_permissions و
+User.has_module_access تحمّل علاقة current_user.permissions في كل طلب (التخزين على g
+يدوم طلباً واحداً فقط). الآن تحتفظ كل عملية لكل مستخدم بـ:
+
+- أعمدة User (بدون العلاقات). load() يبني منها كائناً مرتبطاً بالجلسة عبر
+  merge(load=False) بدون أي استعلام، والعلاقات (employee، departments ...) تُحمّل عند
+  الوصول إليها كالمعتاد
+- خريطة الصلاحيات {Module: بتات الصلاحيات} باستعلام واحد عند أول حاجة إليها
+
+الإصدار: مثل services.notification_hub، لكل مستخدم ملف إشارة في instance/user_signals
+ووقت تعديله هو إصدار المدخل، وملف all لإسقاط كل المدخلات. أي إضافة أو تعديل أو حذف لـ
+User أو UserPermission عبر ORM يُلتقط في after_flush، وبعد commit ناجح يُلمس ملف الإشارة
+فتعيد كل العمليات التحميل في طلبها التالي. التعديلات والحذف الجماعي (query.update/delete)
+على الجدولين تُلتقط في do_orm_execute وتُسقط كل المدخلات. تكلفة الطلب إذن استدعاءا stat
+بدل استعلامين، والمدخل يُعاد تحميله احتياطياً كل ENTRY_TTL ثانية (لتغييرات SQL المباشرة).
+
+USER_CACHE=0 يوقف الذاكرة (يعود السلوك إلى الاستعلام في كل طلب).
+قياس الاستعلامات الموفرة لكل طلب: flask user-cache-benchmark
+"""
+import contextvars
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import event, inspect, select
+from sqlalchemy.orm import Session, make_transient_to_detached
+from sqlalchemy.orm.attributes import set_committed_value
+
+from app import db
+
+logger = logging.getLogger(__name__)
+
+ENABLED = os.environ.get('USER_CACHE', '1').lower() not in ('0', 'false', 'no')
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SIGNALS_DIR = os.path.join(PROJECT_ROOT, 'instance', 'user_signals')
+ALL_USERS = 'all'
+
+ENTRY_TTL = 300
+MAX_ENTRIES = 5000
+
+_SESSION_KEY = 'user_cache_changes'
+
+# استعلامات جدولي المستخدمين والصلاحيات (للقياس فقط)
+_USER_TABLES = re.compile(r'\bFROM\s+"?(user|user_permission)\b(?!\.)', re.IGNORECASE)
+
+# معرف المستخدم -> {'version', 'loaded_at', 'columns', 'permissions'}
+_entries = OrderedDict()
+_lock = threading.Lock()
+_stats = {'hits': 0, 'misses': 0, 'permission_loads': 0}
+
+
+def _signal_path(name):
+    return os.path.join(SIGNALS_DIR, f"user-{name}" if name != ALL_USERS else ALL_USERS)
+
+
+def _mtime(name):
+    try:
+        return os.stat(_signal_path(name)).st_mtime_ns
+    except OSError:
+        return 0
+
+
+def version(user_id):
+    """إصدار بيانات المستخدم (يتغير مع أي تعديل عليه أو على صلاحياته، أو إسقاط عام)"""
+    return (_mtime(ALL_USERS), _mtime(user_id))
+
+
+def _touch(name):
+    path = _signal_path(name)
+    now = time.time_ns()
+    try:
+        try:
+            os.utime(path, ns=(now, now))
+        except FileNotFoundError:
+            os.makedirs(SIGNALS_DIR, exist_ok=True)
+            open(path, 'a').close()
+            os.utime(path, ns=(now, now))
+    except OSError as e:
+        logger.warning(f"تعذر تحديث إشارة المستخدمين {path}: {e}")
+
+
+def invalidate(user_id=None):
+    """إسقاط مدخل مستخدم (أو كل المدخلات) في هذه العملية وكل العمليات الأخرى"""
+    with _lock:
+        if user_id is None:
+            _entries.clear()
+        else:
+            _entries.pop(user_id, None)
+    _touch(ALL_USERS if user_id is None else user_id)
+
+
+def _entry(user_id):
+    """المدخل الصالح للمستخدم أو None"""
+    current = version(user_id)
+    now = time.monotonic()
+    with _lock:
+        entry = _entries.get(user_id)
+        if entry is None:
+            return None, current
+        if entry['version'] != current or now - entry['loaded_at'] >= ENTRY_TTL:
+            del _entries[user_id]
+            return None, current
+        _entries.move_to_end(user_id)
+        return entry, current
+
+
+def _store(user_id, entry_version, columns):
+    with _lock:
+        _entries[user_id] = {'version': entry_version, 'loaded_at': time.monotonic(),
+                             'columns': columns, 'permissions': None}
+        _entries.move_to_end(user_id)
+        while len(_entries) > MAX_ENTRIES:
+            _entries.popitem(last=False)
+
+
+def load(user_id):
+    """
+    المستخدم user_id مرتبطاً بالجلسة الحالية (للاستخدام في login_manager.user_loader)
+
+    :return: User أو None إذا لم يكن موجوداً
+    """
+    from models import User
+
+    if not ENABLED:
+        return db.session.get(User, user_id)
+
+    entry, entry_version = _entry(user_id)
+    if entry is not None:
+        _stats['hits'] += 1
+        mapper = inspect(User)
+        user = mapper.class_manager.new_instance()
+        for key, value in entry['columns'].items():
+            set_committed_value(user, key, value)
+        make_transient_to_detached(user)
+        return db.session.merge(user, load=False)
+
+    _stats['misses'] += 1
+    user = db.session.get(User, user_id)
+    if user is not None:
+        columns = {attr.key: getattr(user, attr.key) for attr in inspect(User).column_attrs}
+        _store(user_id, entry_version, columns)
+    return user
+
+
+def permissions(user):
+    """
+    خريطة صلاحيات المستخدم {Module: بتات الصلاحيات}
+
+    إذا كانت علاقة user.permissions محملة في الجلسة (وربما معدلة قبل الحفظ) تُستخدم هي.
+    """
+    from models import UserPermission
+
+    if 'permissions' in user.__dict__ or not ENABLED or user.id is None:
+        return {item.module: item.permissions or 0 for item in user.permissions}
+
+    entry, entry_version = _entry(user.id)
+    if entry is not None and entry['permissions'] is not None:
+        return dict(entry['permissions'])
+
+    _stats['permission_loads'] += 1
+    result = {module: bits or 0 for module, bits in db.session.execute(
+        select(UserPermission.module, UserPermission.permissions).where(UserPermission.user_id == user.id))}
+    if entry is not None:
+        with _lock:
+            if _entries.get(user.id) is entry:
+                entry['permissions'] = dict(result)
+    return result
+
+
+def stats():
+    """إحصاءات الذاكرة في هذه العملية"""
+    with _lock:
+        return dict(_stats, entries=len(_entries))
+
+
+def benchmark(app, user_id, path='/dashboard/', requests=20):
+    """
+    عدد الاستعلامات لكل طلب للمستخدم user_id بدون الذاكرة ومعها (عبر test_client)
+
+    :return: قائمة بنتيجتين {enabled, queries, user_queries, ms} متوسط كل طلب، حيث
+             user_queries الاستعلامات على جدولي users و user_permission
+    """
+    global ENABLED
+
+    counter = {'queries': 0, 'user_queries': 0}
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        counter['queries'] += 1
+        if _USER_TABLES.search(statement):
+            counter['user_queries'] += 1
+
+    def measure():
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session['_user_id'] = str(user_id)
+            session['_fresh'] = True
+        # طلب تمهيدي يملأ الذاكرة (وذاكرة القوالب) قبل القياس
+        client.get(path)
+        counter.update(queries=0, user_queries=0)
+        started = time.perf_counter()
+        for _ in range(requests):
+            client.get(path)
+        return time.perf_counter() - started
+
+    with app.app_context():
+        engine = db.engine
+    original = ENABLED
+    results = []
+    event.listen(engine, 'before_cursor_execute', count)
+    try:
+        for enabled in (False, True):
+            ENABLED = enabled
+            invalidate(user_id)
+            # سياق فارغ: كل طلب بسياق تطبيق وجلسة جديدين حتى لو استُدعيت من داخل سياق (flask CLI)
+            elapsed = contextvars.Context().run(measure)
+            results.append({
+                'enabled': enabled,
+                'queries': counter['queries'] / requests,
+                'user_queries': counter['user_queries'] / requests,
+                'ms': elapsed * 1000 / requests,
+            })
+    finally:
+        event.remove(engine, 'before_cursor_execute', count)
+        ENABLED = original
+    return results
+
+
+# ---------------------------------------------------------------------------
+# الإسقاط التلقائي عند تعديل User أو UserPermission
+# ---------------------------------------------------------------------------
+
+def _user_id_for(obj):
+    from models import User, UserPermission
+
+    if isinstance(obj, User):
+        return obj.__dict__.get('id')
+    if isinstance(obj, UserPermission):
+        user_id = obj.__dict__.get('user_id')
+        if user_id is None:
+            user = obj.__dict__.get('user')
+            user_id = getattr(user, 'id', None)
+        if user_id is None:
+            # القيمة قبل التعديل (مثلاً بعد فصل الصلاحية عن المستخدم)
+            deleted = inspect(obj).attrs.user_id.history.deleted
+            user_id = deleted[0] if deleted else None
+        return user_id if user_id is not None else ALL_USERS
+    return None
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_changes(session, flush_context):
+    changed = set()
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        user_id = _user_id_for(obj)
+        if user_id is not None:
+            changed.add(user_id)
+    if changed:
+        session.info.setdefault(_SESSION_KEY, set()).update(changed)
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def _collect_bulk_changes(orm_execute_state):
+    from models import User, UserPermission
+
+    if not (orm_execute_state.is_update or orm_execute_state.is_delete):
+        return
+    mapper = orm_execute_state.bind_mapper
+    if mapper is not None and mapper.class_ in (User, UserPermission):
+        orm_execute_state.session.info.setdefault(_SESSION_KEY, set()).add(ALL_USERS)
+
+
+@event.listens_for(Session, 'after_commit')
+def _on_commit(session):
+    changed = session.info.pop(_SESSION_KEY, None)
+    if not changed:
+        return
+    try:
+        if ALL_USERS in changed:
+            invalidate()
+        else:
+            for user_id in changed:
+                invalidate(user_id)
+    except Exception as e:
+        logger.error(f"خطأ في إسقاط ذاكرة المستخدمين: {e}")
+        with _lock:
+            _entries.clear()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _on_rollback(session):
+    session.info.pop(_SESSION_KEY, None)
@@ -0,0 +1,108 @@
+/**
+ * Chunked Upload Client for Mobile Forms
+ * رفع الملفات على دفعات قابلة للاستئناف عبر /mobile/uploads قبل إرسال النموذج
+ * (الواجهة في routes/mobile_uploads.py والتفاصيل في services/upload_sessions.py)
+ *
+ * النموذج يرسل بعدها معرفات الرفع في الحقل upload_ids بدلاً من الملفات نفسها،
+ * فانقطاع الشبكة أثناء رفع صورة كبيرة يستأنف من آخر دفعة محفوظة بدل إعادة النموذج كاملاً.
+ */
+
+class ChunkedUploader {
+    constructor(options = {}) {
+        this.baseUrl = options.baseUrl || '/mobile/uploads';
+        this.csrfToken = options.csrfToken || '';
+        this.maxRetries = options.maxRetries || 5;
+        this.onProgress = options.onProgress || null;
+    }
+
+    _headers(extra = {}) {
+        return Object.assign({'X-CSRFToken': this.csrfToken}, extra);
+    }
+
+    async _json(response) {
+        const data = await response.json().catch(() => ({}));
+        if (!response.ok || data.success === false) {
+            const error = new Error(data.error || `HTTP ${response.status}`);
+            error.status = response.status;
+            error.offset = response.headers.get('Upload-Offset');
+            throw error;
+        }
+        return data;
+    }
+
+    _sleep(ms) {
+        return new Promise(resolve => setTimeout(resolve, ms));
+    }
+
+    /**
+     * رفع ملف واحد على دفعات
+     * @param {File} file - الملف
+     * @returns {Promise<string>} - معرف الرفع بعد اكتماله
+     */
+    async upload(file) {
+        const session = await this._json(await fetch(this.baseUrl, {
+            method: 'POST',
+            credentials: 'same-origin',
+            headers: this._headers({'Content-Type': 'application/json'}),
+            body: JSON.stringify({filename: file.name, size: file.size})
+        }));
+        const uploadUrl = `${this.baseUrl}/${session.upload_id}`;
+        const chunkSize = session.chunk_size;
+        let offset = session.offset;
+        let retries = 0;
+
+        while (offset < file.size) {
+            try {
+                const data = await this._json(await fetch(uploadUrl, {
+                    method: 'PUT',
+                    credentials: 'same-origin',
+                    headers: this._headers({
+                        'Content-Type': 'application/octet-stream',
+                        'Upload-Offset': String(offset)
+                    }),
+                    body: file.slice(offset, offset + chunkSize)
+                }));
+                offset = data.offset;
+                retries = 0;
+                if (this.onProgress) this.onProgress(file, offset / file.size);
+            } catch (error) {
+                // 4xx غير التعارض لن يصلحه الاستئناف
+                if (error.status && error.status !== 409 && error.status < 500) throw error;
+                if (++retries > this.maxRetries) throw error;
+                if (error.status === 409 && error.offset !== null) {
+                    offset = parseInt(error.offset, 10);
+                    continue;
+                }
+                // انقطاع الشبكة: انتظار ثم الاستئناف من الإزاحة المحفوظة على الخادم
+                await this._sleep(1000 * Math.pow(2, retries - 1));
+                const status = await fetch(uploadUrl, {
+                    credentials: 'same-origin',
+                    headers: this._headers()
+                }).then(response => this._json(response)).catch(() => null);
+                if (status) offset = status.offset;
+            }
+        }
+
+        await this._json(await fetch(`${uploadUrl}/complete`, {
+            method: 'POST',
+            credentials: 'same-origin',
+            headers: this._headers()
+        }));
+        return session.upload_id;
+    }
+
+    /**
+     * رفع عدة ملفات بالتتابع
+     * @param {File[]} files - الملفات
+     * @returns {Promise<string[]>} - معرفات الرفع بنفس الترتيب
+     */
+    async uploadAll(files) {
+        const uploadIds = [];
+        for (const file of files) {
+            uploadIds.push(await this.upload(file));
+        }
+        return uploadIds;
+    }
+}
+
+window.ChunkedUploader = ChunkedUploader;
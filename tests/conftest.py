@@ -0,0 +1,113 @@
+"""
+إعداد اختبارات الخدمات
+
+ملفات test_*.py في جذر المستودع سكربتات يدوية تعمل على خادم أو قاعدة بيانات حقيقية؛
+اختبارات هذا المجلد تعمل على قاعدة SQLite مؤقتة بدون المجدول وبكتابة سجل المراجعة
+مباشرة (AUDIT_ASYNC=0)، وتُفرغ الجداول بعد كل اختبار.
+
+التشغيل: python -m pytest tests
+"""
+import os
+import sys
+import tempfile
+
+# قبل استيراد التطبيق: لا يلمس أي اختبار قاعدة البيانات المضبوطة في البيئة أو .env
+_TMP = tempfile.mkdtemp(prefix='nuzm-tests-')
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(_TMP, 'test.db')
+os.environ['SCHEDULER_ENABLED'] = '0'
+os.environ['AUDIT_ASYNC'] = '0'
+os.environ.setdefault('SESSION_SECRET', 'tests')
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest  # noqa: E402
+from sqlalchemy import inspect  # noqa: E402
+
+from app import app as flask_app, db  # noqa: E402
+
+
+@pytest.fixture(scope='session')
+def app():
+    flask_app.config.update(TESTING=True, WTF_CSRF_ENABLED=False)
+    with flask_app.app_context():
+        # create_all يتوقف عند أول جدول يفشل إنشاؤه في SQLite؛ هنا كل جدول على حدة
+        for table in db.metadata.sorted_tables:
+            try:
+                table.create(db.engine, checkfirst=True)
+            except Exception:
+                pass
+    return flask_app
+
+
+@pytest.fixture
+def ctx(app):
+    """سياق تطبيق لكل اختبار، وتفريغ كل الجداول بعده"""
+    with app.app_context():
+        yield app
+        db.session.rollback()
+        db.session.remove()
+        existing = set(inspect(db.engine).get_table_names())
+        with db.engine.begin() as connection:
+            for table in reversed(db.metadata.sorted_tables):
+                if table.name in existing:
+                    connection.execute(table.delete())
+
+
+@pytest.fixture
+def tmp_dir():
+    return tempfile.mkdtemp(dir=_TMP)
+
+
+@pytest.fixture(autouse=True)
+def storage_dirs(monkeypatch):
+    """مخزن الملفات وجلسات الرفع وملفات الإشارات (instance/*_signals) في مجلد الاختبار لا في المستودع"""
+    from services import blob_store, notification_hub, report_datasets, share_packages, upload_sessions, user_cache
+
+    root = tempfile.mkdtemp(dir=_TMP)
+    monkeypatch.setattr(blob_store, 'PROJECT_ROOT', root)
+    monkeypatch.setattr(blob_store, 'BLOB_ROOT', os.path.join(root, 'static', 'uploads', 'blobs'))
+    monkeypatch.setattr(upload_sessions, 'SESSIONS_DIR', os.path.join(root, 'upload_sessions'))
+    for module in (notification_hub, report_datasets, share_packages, user_cache):
+        monkeypatch.setattr(module, 'SIGNALS_DIR', os.path.join(root, module.__name__.rsplit('.', 1)[-1]))
+    return root
+
+
+@pytest.fixture
+def admin(ctx):
+    from models import User, UserRole
+
+    user = User(email='admin@tests.local', name='مدير', role=UserRole.ADMIN)
+    user.set_password('secret')
+    db.session.add(user)
+    db.session.commit()
+    return user
+
+
+@pytest.fixture
+def client(ctx, admin):
+    """عميل اختبار مسجل الدخول بالمدير"""
+    client = ctx.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(admin.id)
+        session['_fresh'] = True
+    return client
+
+
+@pytest.fixture
+def make_employee(ctx):
+    """إنشاء موظف (واختيارياً ربطه بقسم)"""
+    from models import Employee
+
+    counter = {'n': 0}
+
+    def make(name=None, department=None, **fields):
+        counter['n'] += 1
+        n = counter['n']
+        employee = Employee(name=name or f'موظف {n}', employee_id=f'E{n:04d}', national_id=f'1{n:09d}',
+                            mobile='0500000000', job_title='فني', status='active', **fields)
+        if department is not None:
+            employee.departments.append(department)
+        db.session.add(employee)
+        db.session.flush()
+        return employee
+    return make
@@ -0,0 +1,57 @@
+"""سجل المراجعة (services/audit_writer): لا يحفظ معاملة المستدعي ولا يضيع بعد الطلب"""
+from datetime import date
+
+from sqlalchemy import func, select
+
+from app import db
+
+
+def _count(model):
+    # اتصال مستقل: يرى المحفوظ فعلاً فقط
+    with db.engine.connect() as connection:
+        return connection.execute(select(func.count()).select_from(model.__table__)).scalar()
+
+
+def test_department_attendance_commits_rows_and_audit(client, make_employee):
+    from models import Attendance, AuditLog, Department
+
+    department = Department(name='الصيانة')
+    db.session.add(department)
+    db.session.flush()
+    for _ in range(3):
+        make_employee(department=department)
+    db.session.commit()
+
+    response = client.post('/attendance/department', data={
+        'department_id': str(department.id),
+        'date': date.today().isoformat(),
+        'status': 'present',
+    })
+
+    assert response.status_code == 302
+    assert _count(Attendance) == 3
+    assert _count(AuditLog) == 1
+
+
+def test_log_activity_does_not_commit_caller_session(ctx, admin):
+    from models import AuditLog, Department
+    from utils.audit_logger import log_activity
+
+    with ctx.test_request_context():
+        db.session.add(Department(name='لم يُحفظ'))
+        db.session.flush()
+        log_activity('create', 'Department', details='اختبار', user_id=admin.id)
+        assert _count(AuditLog) == 0
+    # نهاية الطلب: المعاملة غير المحفوظة تُلغى ثم يُكتب السجل (بدون database is locked)
+
+    assert _count(Department) == 0
+    assert _count(AuditLog) == 1
+
+
+def test_records_outside_request_are_written(ctx, admin):
+    from models import AuditLog
+    from utils.audit_logger import log_activity
+
+    log_activity('sync', 'System', details='مهمة خلفية', user_id=admin.id)
+
+    assert _count(AuditLog) == 1
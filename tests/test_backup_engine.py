@@ -0,0 +1,71 @@
+"""
+النسخ الاحتياطي: نسخة كاملة ثم تزايدية، واستعادة السلسلة بما فيها الحذف
+"""
+import os
+
+import pytest
+
+from app import db
+from models import Employee, employee_departments
+from services import backup_engine, search_index
+
+TABLES = ['departments', 'employees']
+
+
+def _export(tmp_dir, kind):
+    return backup_engine.export_archive(TABLES, dest=os.path.join(tmp_dir, f'{kind}.zip'), kind=kind)
+
+
+def _names():
+    return [name for (name,) in db.session.query(Employee.name).order_by(Employee.name)]
+
+
+def test_incremental_chain_restores_updates_and_deletes(tmp_dir, make_employee):
+    kept = make_employee(name='باقي')
+    removed = make_employee(name='محذوف')
+    db.session.commit()
+    full, _ = _export(tmp_dir, 'full')
+
+    kept.name = 'باقي معدل'
+    db.session.delete(removed)
+    make_employee(name='جديد')
+    db.session.commit()
+    incremental, manifest = _export(tmp_dir, 'incremental')
+    assert manifest['kind'] == 'incremental'
+    assert manifest['tombstones']['count'] == 1
+    expected = _names()
+
+    db.session.execute(employee_departments.delete())
+    db.session.execute(Employee.__table__.delete())
+    db.session.commit()
+
+    counts, errors = backup_engine.restore_chain([full, incremental], table_names=TABLES)
+    db.session.expire_all()
+
+    assert errors == []
+    assert _names() == expected == sorted(['باقي معدل', 'جديد'])
+
+
+def test_chain_must_start_with_full_backup(tmp_dir, make_employee):
+    make_employee()
+    db.session.commit()
+    _export(tmp_dir, 'full')
+    incremental, _ = _export(tmp_dir, 'incremental')
+
+    with pytest.raises(backup_engine.BackupFormatError):
+        backup_engine.restore_chain([incremental], table_names=TABLES)
+
+
+def test_restored_rows_are_searchable(tmp_dir, make_employee):
+    employee = make_employee(name='سالم الحربي')
+    db.session.commit()
+    path, _ = _export(tmp_dir, None)
+
+    db.session.delete(employee)
+    db.session.commit()
+    assert search_index.ids('employee', 'سالم') == []
+
+    counts, errors = backup_engine.restore(path, mode='add', table_names=TABLES)
+
+    assert errors == [] and counts['employees'] == 1
+    assert search_index.ids('employee', 'سالم') == [employee.id]
@@ -0,0 +1,114 @@
+"""
+مخزن الملفات: اسم الملف بصمة محتواه فلا يُعدّل بعد تخزينه
+"""
+import hashlib
+import io
+import os
+from datetime import datetime
+
+import pytest
+from PIL import Image
+
+from app import db
+from models import FileBlob
+from services import upload_sessions
+from services.blob_store import GC_GRACE, BlobStore, hash_file
+from utils import image_pipeline
+
+
+@pytest.fixture
+def store(ctx, monkeypatch):
+    """النسخ المصغرة تُنشأ مباشرة بدل الخيط الخلفي (المخزن في مجلد الاختبار: conftest)"""
+    scheduled = []
+
+    def submit_variants(path):
+        scheduled.append(path)
+        image_pipeline.generate_variants(path)
+    monkeypatch.setattr(image_pipeline, 'submit_variants', submit_variants)
+    return scheduled
+
+
+def _jpeg(width=2400, height=1200, color=(200, 30, 30)):
+    buffer = io.BytesIO()
+    Image.new('RGB', (width, height), color).save(buffer, 'JPEG', quality=95)
+    return buffer.getvalue()
+
+
+def _digest_of(relative_path):
+    return relative_path.rsplit('/', 1)[-1].split('.')[0]
+
+
+def test_save_image_optimizes_before_hashing(store):
+    path, created = BlobStore.save_image(io.BytesIO(_jpeg()), 'photo.jpg')
+    local = BlobStore.local_path(path)
+
+    assert created
+    assert hash_file(local) == _digest_of(path)
+    with Image.open(local) as img:
+        assert max(img.size) == image_pipeline.MAX_IMAGE_DIMENSION
+    # النسخ المصغرة بجانب الأصل، والأصل لم يتغير بعد إنشائها
+    assert store == [local]
+    assert os.path.exists(image_pipeline.variant_name(local, 'thumb'))
+    assert hash_file(local) == _digest_of(path)
+
+
+def test_same_upload_is_stored_once(store):
+    data = _jpeg()
+    first, created_first = BlobStore.save_image(io.BytesIO(data), 'a.jpg')
+    second, created_second = BlobStore.save_image(io.BytesIO(data), 'b.jpg')
+    db.session.flush()
+
+    assert first == second
+    assert (created_first, created_second) == (True, False)
+    assert len(store) == 1
+    assert FileBlob.query.filter_by(sha256=_digest_of(first)).one().ref_count == 2
+
+
+def test_save_image_options_and_non_images(store):
+    path, _ = BlobStore.save_image(io.BytesIO(_jpeg()), 'id.jpg', max_size=800)
+    with Image.open(BlobStore.local_path(path)) as img:
+        assert max(img.size) == 800
+
+    pdf = b'%PDF-1.4 test'
+    path, created = BlobStore.save_image(io.BytesIO(pdf), 'doc.pdf')
+    with open(BlobStore.local_path(path), 'rb') as f:
+        assert f.read() == pdf
+    assert created
+    # الملفات غير الصور لا تُجدول لها نسخ مصغرة
+    assert len(store) == 1
+
+
+def test_completed_chunked_upload_is_optimized_before_ingest(store, admin):
+    data = _jpeg()
+    session = upload_sessions.start_upload(admin.id, 'photo.jpg', len(data),
+                                           sha256=hashlib.sha256(data).hexdigest())
+    upload_sessions.append_chunk(session['upload_id'], admin.id, 0, io.BytesIO(data), len(data))
+    result = upload_sessions.complete_upload(session['upload_id'], admin.id)
+
+    local = BlobStore.local_path(result['path'])
+    assert result['created'] and result['file_type'] == 'image'
+    assert hash_file(local) == _digest_of(result['path'])
+    with Image.open(local) as img:
+        assert max(img.size) == image_pipeline.MAX_IMAGE_DIMENSION
+
+
+def test_gc_reclaims_blob_whose_record_was_deleted_without_release(store, make_employee):
+    data = b'%PDF-1.4 job offer'
+    path, _ = BlobStore.save(io.BytesIO(data), 'offer.pdf')
+    db.session.commit()
+    # ملف جديد لم يُحفظ سجله بعد لا يُحذف
+    assert BlobStore.collect_garbage(dry_run=True) == (0, 0)
+
+    employee = make_employee(job_offer_file=path, housing_images=f"a.jpg,{path}")
+    FileBlob.query.update({FileBlob.created_at: datetime.utcnow() - GC_GRACE,
+                           FileBlob.last_referenced_at: datetime.utcnow() - GC_GRACE})
+    db.session.commit()
+    assert BlobStore.collect_garbage(dry_run=False) == (0, 0)
+    assert FileBlob.query.one().ref_count == 2
+
+    # مسار الحذف لا يستدعي release: العداد ما زال 2 والمراجع الفعلية صفر
+    db.session.delete(employee)
+    db.session.commit()
+    assert BlobStore.collect_garbage(dry_run=False) == (1, len(data))
+    assert not os.path.exists(BlobStore.local_path(path))
+    assert FileBlob.query.count() == 0
@@ -0,0 +1,57 @@
+"""
+ذاكرة مجلدات Drive: حل المسار مرة واحدة، والإسقاط عند تغيّر المجلد في Drive
+"""
+import pytest
+
+from services import drive_cache
+from services.drive_sync import FakeDriveClient, resolve_folder
+
+
+@pytest.fixture
+def client(ctx):
+    drive_cache.clear()
+    yield FakeDriveClient()
+    drive_cache.clear()
+
+
+def _forget_memory():
+    """عملية أخرى: لا نسخة في ذاكرة العملية، فقط الجدول المشترك"""
+    with drive_cache._lock:
+        drive_cache._memory.clear()
+
+
+def test_folder_path_is_resolved_once_across_processes(client):
+    folder_id = resolve_folder(client, ['طلبات', 'فواتير'])
+    _forget_memory()
+
+    assert resolve_folder(client, ['طلبات', 'فواتير']) == folder_id
+    assert client.calls['find_folder'] == 2
+    assert client.calls['create_folder'] == 2
+
+
+def test_changes_drop_renamed_folder_and_its_children(client):
+    drive_cache.sync_changes(client)  # أول استدعاء يحفظ رمز البداية فقط
+    parent = resolve_folder(client, ['طلبات'])
+    child = resolve_folder(client, ['طلبات', 'فواتير'])
+
+    client.rename_folder(parent, 'طلبات قديمة')
+    assert drive_cache.sync_changes(client) >= 1
+
+    assert drive_cache.get_folder(client.namespace, client.root_folder_id, 'طلبات') is None
+    assert drive_cache.get_folder(client.namespace, parent, 'فواتير') is None
+    assert resolve_folder(client, ['طلبات', 'فواتير']) not in (parent, child)
+
+
+def test_folder_listing_is_cached_until_its_content_changes(client):
+    drive_cache.sync_changes(client)
+    folder_id = resolve_folder(client, ['صور'])
+
+    drive_cache.list_folder(client, folder_id)
+    drive_cache.list_folder(client, folder_id)
+    assert client.calls['list_folder'] == 1
+
+    client.create_folder('جديد', folder_id)
+    drive_cache.sync_changes(client)
+    names = [item['name'] for item in drive_cache.list_folder(client, folder_id)]
+    assert names == ['جديد']
+    assert client.calls['list_folder'] == 2
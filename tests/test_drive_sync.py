@@ -0,0 +1,118 @@
+"""
+مزامنة Drive: الاستئناف وإعادة المحاولة والمجلدات المحذوفة (بعميل Drive في الذاكرة)
+"""
+import os
+from datetime import datetime
+
+import pytest
+
+from app import db
+from models import DriveSyncJob
+from services import drive_cache, drive_sync
+from services.drive_sync import DriveError, FakeDriveClient
+
+FOLDER = ['طلبات الموظفين', 'فواتير']
+
+
+@pytest.fixture
+def local_files(ctx, tmp_dir, monkeypatch):
+    monkeypatch.setattr(drive_sync, 'PROJECT_ROOT', tmp_dir)
+    # العامل في الخلفية يستخدم Drive الحقيقي؛ الاختبارات تشغّل sync_due بنفسها
+    monkeypatch.setattr(drive_sync, 'schedule_sync', lambda app=None: None)
+    drive_cache.clear()
+
+    def write(name, data=b'0123456789'):
+        with open(os.path.join(tmp_dir, name), 'wb') as f:
+            f.write(data)
+        job = drive_sync.enqueue(name, FOLDER, 'invoice', 1)
+        db.session.commit()
+        return job.id
+    yield write
+    drive_cache.clear()
+
+
+def _job(job_id):
+    db.session.expire_all()
+    return db.session.get(DriveSyncJob, job_id)
+
+
+def _due_now(job_id):
+    job = _job(job_id)
+    job.next_attempt_at = datetime.utcnow()
+    db.session.commit()
+
+
+class FlakyDrive(FakeDriveClient):
+    """ينقطع الاتصال مرة واحدة بعد أول دفعة"""
+
+    def __init__(self):
+        super().__init__()
+        self.failed = False
+
+    def upload_chunk(self, upload_uri, data, offset, total):
+        if offset > 0 and not self.failed:
+            self.failed = True
+            raise DriveError('انقطع الاتصال', 503)
+        return super().upload_chunk(upload_uri, data, offset, total)
+
+
+def test_interrupted_upload_resumes_from_saved_offset_after_backoff(local_files, monkeypatch):
+    monkeypatch.setattr(drive_sync, 'CHUNK_SIZE', 4)
+    client = FlakyDrive()
+    job_id = local_files('invoice.pdf')
+
+    assert drive_sync.sync_due(client=client) == {'done': 0, 'retry': 1, 'failed': 0}
+    job = _job(job_id)
+    assert (job.status, job.bytes_uploaded, job.attempts) == ('pending', 4, 1)
+    assert job.upload_uri
+    delay = (job.next_attempt_at - datetime.utcnow()).total_seconds()
+    assert drive_sync.BACKOFF_BASE * 0.75 < delay <= drive_sync.BACKOFF_BASE * 1.2
+
+    # قبل موعد المحاولة التالية لا يُحجز الملف
+    assert drive_sync.sync_due(client=client) == {'done': 0, 'retry': 0, 'failed': 0}
+    _due_now(job_id)
+    assert drive_sync.sync_due(client=client)['done'] == 1
+
+    job = _job(job_id)
+    assert job.status == 'done' and job.upload_uri is None
+    assert client.calls['start_upload'] == 1
+    assert bytes(client.files[job.drive_file_id]['data']) == b'0123456789'
+
+
+def test_deleted_folder_is_resolved_again_on_retry(local_files):
+    client = FakeDriveClient()
+    first = local_files('a.pdf')
+    drive_sync.sync_due(client=client)
+    dead_folder = _job(first).drive_folder_id
+    client.delete_folder(dead_folder)
+
+    # المعرف المخزن ما زال يشير للمجلد المحذوف
+    job_id = local_files('b.pdf')
+    assert drive_sync.sync_due(client=client)['retry'] == 1
+    job = _job(job_id)
+    assert (job.status, job.drive_folder_id, job.upload_uri) == ('pending', None, None)
+
+    _due_now(job_id)
+    assert drive_sync.sync_due(client=client)['done'] == 1
+    job = _job(job_id)
+    assert job.drive_folder_id not in (None, dead_folder)
+    assert client.files[job.drive_file_id]['parent'] == job.drive_folder_id
+
+
+def test_permanent_errors_and_exhausted_attempts_fail(local_files):
+    missing = local_files('missing.pdf')
+    os.remove(os.path.join(drive_sync.PROJECT_ROOT, 'missing.pdf'))
+    flaky = local_files('flaky.pdf')
+    job = _job(flaky)
+    job.max_attempts = 2
+    db.session.commit()
+    client = FakeDriveClient(fail_chunks=10)
+
+    assert drive_sync.sync_due(client=client) == {'done': 0, 'retry': 1, 'failed': 1}
+    assert _job(missing).status == 'failed'
+    assert 'غير موجود' in _job(missing).last_error
+
+    _due_now(flaky)
+    assert drive_sync.sync_due(client=client)['failed'] == 1
+    job = _job(flaky)
+    assert (job.status, job.attempts) == ('failed', 2)
@@ -0,0 +1,152 @@
+"""
+قائمة الإيميلات: الإضافة ضمن معاملة المستدعي دون حفظها، والإرسال مع إعادة المحاولة
+"""
+from datetime import datetime, timedelta
+
+import pytest
+from sendgrid.helpers.mail import Mail
+
+from app import db
+from models import Department, QueuedEmail
+from services import email_queue
+from services.email_service import EmailService
+
+
+@pytest.fixture
+def deliveries(ctx, monkeypatch):
+    scheduled = []
+    monkeypatch.setattr(email_queue, 'schedule_delivery', lambda app=None: scheduled.append(True))
+    return scheduled
+
+
+class FakeTransport:
+    """ناقل وهمي: كل خيط ينشئ نسخته من options (كما يفعل deliver_due) فالنتائج مشتركة"""
+
+    name = 'fake'
+
+    def __init__(self, errors=None, sent=None):
+        self.options = dict(errors={} if errors is None else errors, sent=[] if sent is None else sent)
+
+    def open(self):
+        pass
+
+    def close(self):
+        pass
+
+    def send(self, email):
+        error = self.options['errors'].get(email['to_email'])
+        if error is not None:
+            raise error
+        self.options['sent'].append(email['to_email'])
+        return f"fake-{email['id']}"
+
+
+def _queue(to_email, **fields):
+    email = email_queue.EmailQueue.enqueue(to_email, 'موضوع', '<p>x</p>')
+    for name, value in fields.items():
+        setattr(email, name, value)
+    db.session.commit()
+    return email
+
+
+def _count(model):
+    with db.engine.connect() as connection:
+        return connection.execute(db.select(db.func.count()).select_from(model.__table__)).scalar()
+
+
+def test_enqueue_without_commit_leaves_caller_transaction_open(deliveries):
+    db.session.add(Department(name='قسم غير محفوظ'))
+    email_queue.EmailQueue.enqueue('a@tests.local', 'موضوع', '<p>x</p>', commit=False)
+
+    assert _count(Department) == 0
+    assert _count(QueuedEmail) == 0
+    assert deliveries == []
+
+    db.session.commit()
+    assert (_count(Department), _count(QueuedEmail)) == (1, 1)
+    assert deliveries == [True]
+
+
+def test_rolled_back_email_is_not_sent(deliveries):
+    email_queue.EmailQueue.enqueue('a@tests.local', 'موضوع', '<p>x</p>', commit=False)
+    db.session.rollback()
+    db.session.commit()
+
+    assert _count(QueuedEmail) == 0
+    assert deliveries == []
+
+
+def test_sendgrid_service_does_not_commit(deliveries):
+    service = EmailService.__new__(EmailService)
+    db.session.add(Department(name='قسم غير محفوظ'))
+
+    queued = service._enqueue(Mail(from_email='noreply@tests.local', to_emails='a@tests.local',
+                                   subject='موضوع', html_content='<p>x</p>'))
+
+    assert queued.id is not None
+    assert _count(Department) == 0
+    assert deliveries == []
+
+
+def test_deliver_due_sends_and_records_result(deliveries):
+    email = _queue('a@tests.local')
+    transport = FakeTransport()
+
+    assert email_queue.deliver_due(transport=transport) == {'sent': 1, 'retry': 0, 'failed': 0}
+    db.session.refresh(email)
+    assert transport.options['sent'] == ['a@tests.local']
+    assert (email.status, email.attempts, email.transport) == (email_queue.STATUS_SENT, 1, 'fake')
+    assert email.sent_at is not None and email.locked_until is None
+
+
+def test_transient_error_is_retried_with_backoff(deliveries):
+    email = _queue('a@tests.local')
+    errors = {'a@tests.local': ConnectionError('timeout')}
+    transport = FakeTransport(errors)
+
+    before = datetime.utcnow()
+    assert email_queue.deliver_due(transport=transport) == {'sent': 0, 'retry': 1, 'failed': 0}
+    db.session.refresh(email)
+    assert (email.status, email.attempts, email.last_error) == (email_queue.STATUS_QUEUED, 1, 'timeout')
+    # المحاولة الأولى: BACKOFF_BASE ثانية ±20%
+    delay = (email.next_attempt_at - before).total_seconds()
+    assert email_queue.BACKOFF_BASE * 0.8 <= delay <= email_queue.BACKOFF_BASE * 1.2 + 5
+
+    # غير مستحق قبل انتهاء التأخير
+    assert email_queue.deliver_due(transport=transport) == {'sent': 0, 'retry': 0, 'failed': 0}
+
+    errors.clear()
+    email.next_attempt_at = datetime.utcnow() - timedelta(seconds=1)
+    db.session.commit()
+    assert email_queue.deliver_due(transport=transport) == {'sent': 1, 'retry': 0, 'failed': 0}
+    db.session.refresh(email)
+    assert (email.status, email.attempts, email.last_error) == (email_queue.STATUS_SENT, 2, None)
+
+
+def test_failure_is_permanent_at_max_attempts(deliveries):
+    email = _queue('a@tests.local', max_attempts=2)
+    rejected = _queue('b@tests.local')
+    transport = FakeTransport({'a@tests.local': ConnectionError('timeout'),
+                               'b@tests.local': email_queue.PermanentDeliveryError('550 rejected')})
+
+    # الخطأ الدائم لا يُعاد، والمؤقت يُعاد حتى max_attempts
+    assert email_queue.deliver_due(transport=transport) == {'sent': 0, 'retry': 1, 'failed': 1}
+    email.next_attempt_at = datetime.utcnow() - timedelta(seconds=1)
+    db.session.commit()
+    assert email_queue.deliver_due(transport=transport) == {'sent': 0, 'retry': 0, 'failed': 1}
+
+    db.session.refresh(email)
+    db.session.refresh(rejected)
+    assert (email.status, email.attempts, email.last_error) == (email_queue.STATUS_FAILED, 2, 'timeout')
+    assert (rejected.status, rejected.attempts) == (email_queue.STATUS_FAILED, 1)
+    assert email_queue.deliver_due(transport=transport) == {'sent': 0, 'retry': 0, 'failed': 0}
+
+
+def test_sendgrid_service_reports_queued_not_sent(deliveries):
+    service = EmailService.__new__(EmailService)
+    service.sendgrid_key = 'test-key'
+
+    result = service.send_simple_email('a@tests.local', 'موضوع', '<p>x</p>', sender_email='noreply@tests.local')
+
+    assert result['success'] and 'قائمة الإرسال' in result['message']
+    assert QueuedEmail.query.filter_by(message_id=result['message_id']).one().status == email_queue.STATUS_QUEUED
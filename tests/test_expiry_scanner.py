@@ -0,0 +1,58 @@
+"""
+ماسح انتهاء الصلاحيات: تنبيه واحد لكل عتبة مهما تكرر التشغيل
+"""
+from datetime import date, timedelta
+
+import pytest
+
+from app import db
+from models import Department, Document, Notification, User, UserRole
+from services import expiry_scanner
+
+TODAY = date(2026, 5, 1)
+
+
+@pytest.fixture
+def document(admin, make_employee):
+    department = Department(name='التشغيل')
+    member = User(email='hr@tests.local', name='موارد', role=UserRole.HR)
+    outsider = User(email='other@tests.local', name='آخر', role=UserRole.USER)
+    member.set_password('secret')
+    outsider.set_password('secret')
+    db.session.add_all([department, member, outsider])
+    db.session.flush()
+    member.assigned_department_id = department.id
+    employee = make_employee(department=department)
+    document = Document(employee_id=employee.id, document_type='passport', document_number='P1',
+                        expiry_date=TODAY + timedelta(days=10))
+    db.session.add(document)
+    db.session.commit()
+    return {'document': document, 'recipients': {admin.id, member.id}}
+
+
+def _scan(today=TODAY, **options):
+    return expiry_scanner.scan(today=today, sources=['document'], **options)['document']
+
+
+def test_rerun_does_not_duplicate_alerts(document):
+    assert _scan() == {'matched': 1, 'alerts': 1, 'notifications': 2}
+    assert {n.user_id for n in Notification.query.all()} == document['recipients']
+
+    assert _scan() == {'matched': 1, 'alerts': 0, 'notifications': 0}
+    assert Notification.query.count() == 2
+
+
+def test_next_threshold_and_renewal_start_new_alerts(document):
+    _scan()
+    # بعد خمسة أيام يتبقى 5 أيام: عتبة 7 جديدة
+    assert _scan(today=TODAY + timedelta(days=5))['alerts'] == 1
+
+    document['document'].expiry_date = TODAY + timedelta(days=12)
+    db.session.commit()
+    assert _scan(today=TODAY + timedelta(days=5))['alerts'] == 1
+
+
+def test_dry_run_writes_nothing(document):
+    assert _scan(dry_run=True)['notifications'] == 2
+    assert Notification.query.count() == 0
+    assert _scan()['alerts'] == 1
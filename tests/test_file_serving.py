@@ -0,0 +1,73 @@
+"""
+ترويسات التخزين المؤقت للملفات المرفوعة
+"""
+import os
+import uuid
+
+import pytest
+from PIL import Image
+
+from utils import file_serving
+from utils.image_pipeline import process_image
+
+DIGEST = 'ab' * 32
+BLOB = f'blobs/ab/ab/{DIGEST}.jpg'
+
+
+@pytest.fixture
+def uploads(client, tmp_dir, monkeypatch):
+    """مجلد رفع مؤقت يحتوي صورة في المخزن (بدون نسخها المصغرة)"""
+    monkeypatch.chdir(tmp_dir)
+    file_serving.invalidate_path()
+    path = os.path.join('static', 'uploads', BLOB)
+    os.makedirs(os.path.dirname(path))
+    with open(path, 'wb') as f:
+        f.write(b'original')
+    yield path
+    file_serving.invalidate_path()
+
+
+def test_original_is_immutable(client, uploads):
+    response = client.get(f'/static/uploads/{BLOB}')
+
+    assert response.data == b'original'
+    assert response.cache_control.immutable
+    assert response.cache_control.max_age == file_serving.IMMUTABLE_MAX_AGE
+
+
+def test_missing_variant_falls_back_with_short_max_age(client, uploads):
+    response = client.get(f'/static/uploads/{BLOB}?size=thumb')
+
+    assert response.data == b'original'
+    assert not response.cache_control.immutable
+    assert response.cache_control.max_age == file_serving.PROVISIONAL_MAX_AGE
+
+
+def test_existing_variant_is_immutable(client, uploads):
+    with open(uploads.replace('.jpg', '.thumb.webp'), 'wb') as f:
+        f.write(b'thumb')
+
+    response = client.get(f'/static/uploads/{BLOB}?size=thumb')
+
+    assert response.data == b'thumb'
+    assert response.cache_control.immutable
+
+
+def test_random_hex_name_outside_blobs_revalidates_after_rewrite(client, uploads):
+    name = f'safety_checks/safety_check_1_{uuid.uuid4().hex}.jpg'
+    path = os.path.join('static', 'uploads', name)
+    os.makedirs(os.path.dirname(path))
+    Image.new('RGB', (400, 300), (200, 30, 30)).save(path, 'JPEG', quality=100)
+
+    first = client.get(f'/static/uploads/{name}')
+    assert not first.cache_control.immutable
+    assert first.cache_control.max_age == client.application.config.get(
+        'UPLOADS_CACHE_MAX_AGE', file_serving.DEFAULT_MAX_AGE)
+
+    # المعالجة في الخلفية (submit_image) تعيد كتابة الملف في مكانه
+    process_image(path, max_size=100)
+    second = client.get(f'/static/uploads/{name}', headers={'If-None-Match': first.headers['ETag']})
+
+    assert second.status_code == 200
+    assert second.data != first.data
+    assert second.headers['ETag'] != first.headers['ETag']
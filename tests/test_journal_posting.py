@@ -0,0 +1,56 @@
+"""
+ترحيل القيود دفعة واحدة: الأرقام المتتالية والأرصدة ورفض الدفعة كاملة عند أي خطأ
+"""
+from datetime import date
+from decimal import Decimal
+
+import pytest
+
+from app import db
+from models_accounting import (Account, AccountingSettings, AccountType, FiscalYear, Transaction,
+                               TransactionEntry, TransactionType)
+from services import journal_posting, ledger_balances
+from services.journal_posting import PostingError, credit, debit
+
+
+@pytest.fixture
+def accounts(admin):
+    year = FiscalYear(name='2026', year=2026, start_date=date(2026, 1, 1), end_date=date(2026, 12, 31))
+    bank = Account(code='1200', name='البنك', account_type=AccountType.ASSETS)
+    salaries = Account(code='5200', name='رواتب', account_type=AccountType.EXPENSES)
+    closed = Account(code='5900', name='موقوف', account_type=AccountType.EXPENSES, is_active=False)
+    db.session.add_all([year, bank, salaries, closed])
+    db.session.commit()
+    return {'bank': bank, 'salaries': salaries, 'closed': closed, 'user': admin}
+
+
+def _salary(amount, account='5200', description=None):
+    return {'transaction_date': date(2026, 4, 30), 'transaction_type': TransactionType.SALARY,
+            'description': description or f'راتب {amount}',
+            'lines': [debit(account, amount), credit('1200', amount)]}
+
+
+def test_batch_gets_consecutive_numbers_and_updates_balances(accounts):
+    db.session.add(AccountingSettings(company_name='نظم', next_transaction_number=7))
+    db.session.commit()
+
+    posted = journal_posting.post([_salary('1000'), _salary('2500.50')], accounts['user'].id)
+    db.session.commit()
+    db.session.expire_all()
+
+    assert [number for _, number in posted] == ['JV000007', 'JV000008']
+    assert db.session.get(AccountingSettings, 1).next_transaction_number == 9
+    assert TransactionEntry.query.count() == 4
+    assert db.session.get(Account, accounts['salaries'].id).balance == Decimal('3500.50')
+    assert ledger_balances.verify() == {'periods': [], 'balances': []}
+
+
+def test_invalid_entry_rejects_whole_batch(accounts):
+    unbalanced = _salary('100')
+    unbalanced['lines'][1] = credit('1200', '90')
+
+    with pytest.raises(PostingError) as error:
+        journal_posting.post([_salary('100'), unbalanced, _salary('50', account='5900')], accounts['user'].id)
+
+    assert len(error.value.errors) == 2
+    assert Transaction.query.count() == 0
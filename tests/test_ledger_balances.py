@@ -0,0 +1,80 @@
+"""
+أرصدة الحسابات ولقطاتها الشهرية: التحديث عند حفظ القيود والبناء الأول بعد الترقية
+"""
+from datetime import date
+from decimal import Decimal
+
+import pytest
+from sqlalchemy import delete, update
+
+from app import db
+from models_accounting import (Account, AccountPeriodBalance, AccountType, EntryType, FiscalYear, Transaction,
+                               TransactionEntry, TransactionType)
+from services import ledger_balances
+
+
+@pytest.fixture
+def accounts(admin):
+    year = FiscalYear(name='2026', year=2026, start_date=date(2026, 1, 1), end_date=date(2026, 12, 31))
+    cash = Account(code='1100', name='الصندوق', account_type=AccountType.ASSETS)
+    fuel = Account(code='5100', name='وقود', account_type=AccountType.EXPENSES)
+    db.session.add_all([year, cash, fuel])
+    db.session.commit()
+    return {'year': year, 'cash': cash, 'fuel': fuel, 'user': admin}
+
+
+def _post(accounts, day, amount, approved=True, number=None):
+    amount = Decimal(amount)
+    transaction = Transaction(
+        transaction_number=number or f'JV-{day:%m%d}-{amount}', transaction_date=day,
+        transaction_type=TransactionType.VEHICLE_EXPENSE, description='وقود', total_amount=amount,
+        fiscal_year_id=accounts['year'].id, created_by_id=accounts['user'].id, is_approved=approved)
+    transaction.entries = [
+        TransactionEntry(account_id=accounts['fuel'].id, entry_type=EntryType.DEBIT, amount=amount),
+        TransactionEntry(account_id=accounts['cash'].id, entry_type=EntryType.CREDIT, amount=amount),
+    ]
+    db.session.add(transaction)
+    db.session.commit()
+    return transaction
+
+
+def _balance(account):
+    return db.session.get(Account, account.id).balance
+
+
+def test_posting_updates_snapshots_and_balances(accounts):
+    _post(accounts, date(2026, 1, 10), '100')
+    _post(accounts, date(2026, 2, 5), '40')
+    pending = _post(accounts, date(2026, 2, 6), '7', approved=False)
+    db.session.expire_all()
+
+    assert _balance(accounts['fuel']) == Decimal('140')
+    assert _balance(accounts['cash']) == Decimal('-140')
+    assert ledger_balances.period_totals(date(2026, 2, 1), date(2026, 2, 28))[accounts['fuel'].id] == \
+        [Decimal('40'), Decimal('0')]
+
+    pending.is_approved = True
+    db.session.commit()
+    db.session.expire_all()
+    assert _balance(accounts['fuel']) == Decimal('147')
+    assert ledger_balances.verify() == {'periods': [], 'balances': []}
+
+
+def test_backfill_builds_empty_table_from_journal(accounts):
+    _post(accounts, date(2026, 3, 1), '250')
+    # قاعدة بيانات قبل الترقية: القيود موجودة والجدول فارغ والأرصدة يدوية
+    db.session.execute(delete(AccountPeriodBalance.__table__))
+    db.session.execute(update(Account.__table__).values(balance=0))
+    db.session.commit()
+    assert ledger_balances.verify()['balances']
+
+    assert ledger_balances.ensure_backfill() == 2
+    assert ledger_balances.verify() == {'periods': [], 'balances': []}
+    # البناء مرة واحدة فقط؛ بعدها تُحدّث اللقطات مع كل حفظ
+    assert ledger_balances.ensure_backfill() is None
+
+
+def test_backfill_skips_without_approved_entries(accounts):
+    _post(accounts, date(2026, 3, 1), '250', approved=False)
+
+    assert ledger_balances.ensure_backfill() is None
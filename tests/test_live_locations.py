@@ -0,0 +1,54 @@
+"""
+المواقع الحية: الرد بالمؤشر يحتوي من تحرّك فقط، ولا يُحفظ إلا ما حُفظ في قاعدة البيانات
+"""
+from datetime import datetime, timedelta
+
+import pytest
+
+from app import db
+from models import EmployeeLocation
+from services import live_locations
+
+
+def _locate(employee, minutes_ago=0, latitude=24.7):
+    db.session.add(EmployeeLocation(employee_id=employee.id, latitude=latitude, longitude=46.7,
+                                    recorded_at=datetime.utcnow() - timedelta(minutes=minutes_ago)))
+
+
+@pytest.fixture
+def employees(make_employee):
+    first, second = make_employee(), make_employee()
+    _locate(first, minutes_ago=2)
+    _locate(second, minutes_ago=2)
+    db.session.commit()
+    # الذاكرة مشتركة بين الاختبارات: تحميل كامل من القاعدة الحالية
+    live_locations.refresh(force=True)
+    return first, second
+
+
+def test_cursor_feed_returns_only_committed_moves(employees):
+    first, second = employees
+    locations, cursor, full = live_locations.feed()
+    assert full and set(locations) == {str(first.id), str(second.id)}
+    assert locations[str(first.id)]['status'] == 'active'
+
+    assert live_locations.feed(cursor)[0] == {}
+
+    _locate(first, latitude=24.8)
+    db.session.commit()
+    _locate(second, latitude=24.8)
+    db.session.rollback()
+
+    locations, cursor, full = live_locations.feed(cursor)
+    assert not full
+    assert list(locations) == [str(first.id)]
+    assert locations[str(first.id)]['latitude'] == pytest.approx(24.8)
+
+
+def test_late_location_does_not_move_marker_back(employees):
+    first, _ = employees
+    _locate(first, minutes_ago=10, latitude=25.0)
+    db.session.commit()
+
+    positions, _ = live_locations.latest()
+    assert float(positions[first.id]['latitude']) == pytest.approx(24.7)
@@ -0,0 +1,32 @@
+"""
+إشعارات النظام: الإرسال لكل المستخدمين وعداد غير المقروء بعد الحفظ
+"""
+import pytest
+
+from app import db
+from models import User, UserRole
+from routes.notifications import get_all_user_ids, notify_all_users
+from services import notification_hub
+from services.notification_hub import USER
+
+
+@pytest.fixture
+def users(admin):
+    user = User(email='fleet@tests.local', name='مشرف', role=UserRole.FLEET)
+    user.set_password('secret')
+    db.session.add(user)
+    db.session.commit()
+    notification_hub.invalidate()
+    yield [admin, user]
+    notification_hub.invalidate()
+
+
+def test_notify_all_users_reaches_non_admins(users):
+    assert sorted(get_all_user_ids()) == sorted(user.id for user in users)
+
+    assert notify_all_users('operations', 'عملية جديدة', 'وصف') == 2
+    # العداد المحسوب قبل الحفظ لا يشمل الإشعارات المعلقة فلا تُحسب مرتين بعده
+    assert notification_hub.unread_count(USER, users[1].id) == 0
+    db.session.commit()
+
+    assert [notification_hub.unread_count(USER, user.id) for user in users] == [1, 1]
@@ -0,0 +1,22 @@
+"""
+التحميل المسبق: جداول البحث في العملية الرئيسية وعملاء HTTP جديدة في كل عامل
+"""
+from services import preload
+from services.drive_sync import DriveClient
+from services.email_queue import SendGridTransport
+
+
+def test_warm_lookups_builds_static_tables(app):
+    assert preload._warm_lookups(app) == 4
+
+
+def test_worker_does_not_reuse_master_http_sessions(monkeypatch):
+    monkeypatch.setattr(SendGridTransport, '_session', None)
+    monkeypatch.setattr(DriveClient, '_session', None)
+    monkeypatch.setattr(DriveClient, '_token', 'master-token')
+    master = SendGridTransport.session()
+
+    preload._reset_http_clients()
+
+    assert DriveClient._token is None
+    assert SendGridTransport.session() is not master
@@ -0,0 +1,55 @@
+"""
+ذاكرة التقارير: الإسقاط عند الحفظ في هذه العملية وفي العمليات الأخرى
+"""
+import os
+
+import pytest
+
+from app import db
+from services import report_datasets
+
+
+@pytest.fixture
+def reports(ctx):
+    report_datasets.clear()
+    yield report_datasets
+    report_datasets.clear()
+
+
+def test_report_is_cached_until_a_dependency_is_committed(reports, make_employee):
+    make_employee(name='أول')
+    db.session.commit()
+    first = reports.employees()
+
+    assert reports.employees() is first
+
+    make_employee(name='ثان')
+    db.session.flush()
+    # قبل الحفظ تبقى النسخة المخزنة
+    assert reports.employees() is first
+    db.session.commit()
+
+    assert len(reports.employees()) == 2
+    assert os.path.exists(os.path.join(reports.SIGNALS_DIR, 'employee'))
+
+
+def test_commit_in_another_process_invalidates_cache(reports, make_employee):
+    make_employee()
+    db.session.commit()
+    first = reports.employees()
+
+    # عملية أخرى حفظت تعديلاً على الموظفين: تلمس ملف الإشارة فقط
+    reports._touch('employee')
+
+    assert reports.employees() is not first
+
+
+def test_rolled_back_changes_do_not_invalidate(reports, make_employee):
+    make_employee()
+    db.session.commit()
+    first = reports.employees()
+
+    make_employee()
+    db.session.rollback()
+
+    assert reports.employees() is first
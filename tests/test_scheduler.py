@@ -0,0 +1,54 @@
+"""
+المجدول: تسجيل التشغيل وتحرير قفل القيادة
+"""
+from models import SchedulerJobRun
+from services import scheduler
+
+
+class FakeConnection:
+    """اتصال يسجل الأوامر بدل PostgreSQL"""
+
+    def __init__(self, broken=False):
+        self.calls = []
+        self.broken = broken
+
+    def execute(self, statement, parameters=None):
+        if self.broken:
+            raise ConnectionError('server closed the connection')
+        self.calls.append(str(statement))
+
+    def commit(self):
+        self.calls.append('commit')
+
+    def invalidate(self):
+        self.calls.append('invalidate')
+
+    def close(self):
+        self.calls.append('close')
+
+
+def test_release_unlocks_before_returning_connection_to_pool():
+    lock = scheduler._AdvisoryLock(engine=None)
+    lock.connection = connection = FakeConnection()
+
+    lock.release()
+
+    assert connection.calls == ['SELECT pg_advisory_unlock(:key)', 'commit', 'close']
+    assert lock.connection is None
+
+
+def test_release_invalidates_connection_when_unlock_fails():
+    lock = scheduler._AdvisoryLock(engine=None)
+    lock.connection = connection = FakeConnection(broken=True)
+
+    lock.release()
+
+    assert connection.calls == ['invalidate', 'close']
+
+
+def test_run_records_job_result(ctx, monkeypatch):
+    monkeypatch.setitem(scheduler._jobs, 'test-job', (lambda: 3, {'hours': 1}, False))
+
+    assert scheduler.run('test-job', ctx) == 3
+    record = SchedulerJobRun.query.filter_by(job_name='test-job').one()
+    assert (record.status, record.rows_affected) == (scheduler.STATUS_SUCCESS, 3)
@@ -0,0 +1,58 @@
+"""
+فهرس البحث: التحديث عند الحفظ وعزل أخطائه عن معاملة البيانات
+"""
+import time
+
+from sqlalchemy import text
+
+from app import db
+from models import Employee, SearchEntry
+from services import search_index
+
+
+def _indexed(employee):
+    return SearchEntry.query.filter_by(entity='employee', entity_id=employee.id).first()
+
+
+def test_saved_employee_is_searchable_with_normalized_spelling(make_employee):
+    employee = make_employee(name='أحمد العتيبي')
+    db.session.commit()
+
+    assert search_index.ids('employee', 'احمد العتيبى') == [employee.id]
+
+
+def test_index_failure_is_rolled_back_alone(make_employee, monkeypatch):
+    def failing_remove(connection, entity, entity_ids):
+        raise RuntimeError('index write failed')
+    monkeypatch.setattr(search_index, '_remove', failing_remove)
+
+    employee = make_employee(name='سالم')
+    db.session.commit()
+
+    # الموظف محفوظ، وما كُتب في الفهرس قبل الخطأ أُلغي مع نقطة الحفظ
+    assert db.session.get(Employee, employee.id) is not None
+    assert _indexed(employee) is None
+
+
+def test_worker_switches_from_like_after_leader_creates_fts(make_employee, monkeypatch):
+    make_employee(name='أحمد العتيبي')
+    db.session.commit()
+    monkeypatch.setitem(search_index._state, 'backend', None)
+    assert search_index._backend() == 'like'
+
+    try:
+        # مهمة search-index-setup على القائد بعد أن اكتشف هذا العامل LIKE
+        with db.engine.begin() as connection:
+            for statement in search_index._SQLITE_SCHEMA:
+                connection.execute(text(statement))
+            connection.execute(text(f"INSERT INTO {search_index.FTS_TABLE}({search_index.FTS_TABLE}) VALUES ('rebuild')"))
+        assert search_index._backend() == 'like'
+
+        monkeypatch.setitem(search_index._state, 'checked_at', time.monotonic() - search_index.BACKEND_RECHECK)
+        assert search_index._backend() == 'fts5'
+        assert len(search_index.ids('employee', 'العتيبى')) == 1
+    finally:
+        with db.engine.begin() as connection:
+            for trigger in ('search_index_ai', 'search_index_ad', 'search_index_au'):
+                connection.execute(text(f"DROP TRIGGER IF EXISTS {trigger}"))
+            connection.execute(text(f"DROP TABLE IF EXISTS {search_index.FTS_TABLE}"))
@@ -0,0 +1,51 @@
+"""
+مسارات الموظفين: تقسيم النقاط إلى وقفات ورحلات وتبسيط الهندسة
+"""
+import numpy as np
+
+from services import trajectories
+
+# نحو 111 متراً لكل 0.001 درجة عرض
+STEP = 0.001
+
+
+def _track(*parts):
+    """نقاط كل دقيقة من أجزاء (عدد النقاط، إزاحة كل نقطة بالدرجات)"""
+    lat, lon = [24.7], [46.7]
+    for count, step in parts:
+        for _ in range(count):
+            lat.append(lat[-1] + step)
+            lon.append(lon[-1])
+    seconds = np.arange(len(lat)) * 60.0
+    return seconds, np.array(lat), np.array(lon)
+
+
+def test_trip_connects_the_stops_around_it():
+    # وقفة 10 دقائق ثم حركة 5 دقائق ثم وقفة 10 دقائق
+    seconds, lat, lon = _track((10, 0), (5, 2 * STEP), (10, 0))
+
+    stops, trips = trajectories.segment(seconds, lat, lon)
+
+    assert stops == [(0, 10), (15, 25)]
+    assert trips == [(10, 15, 11, 14)]
+
+
+def test_signal_gap_splits_a_trip():
+    seconds, lat, lon = _track((8, 2 * STEP))
+    seconds[5:] += trajectories.MAX_GAP_SECONDS
+
+    stops, trips = trajectories.segment(seconds, lat, lon)
+
+    assert stops == []
+    assert trips == [(0, 4, 0, 4), (5, 8, 5, 8)]
+
+
+def test_simplify_drops_collinear_points_and_keeps_turns_when_zoomed_in():
+    lat = np.array([24.7, 24.701, 24.702, 24.703, 24.703, 24.703])
+    lon = np.array([46.7, 46.7, 46.7, 46.7, 46.701, 46.702])
+
+    geometry = trajectories.simplify(lat, lon)
+
+    assert geometry[16] == geometry[13] == [[24.7, 46.7], [24.703, 46.7], [24.703, 46.702]]
+    # المنعطف (نحو 170 متراً عن الخط المستقيم) أقل من بكسل ونصف عند التكبير 10
+    assert geometry[10] == [[24.7, 46.7], [24.703, 46.702]]
@@ -0,0 +1,95 @@
+"""
+جلسات الرفع المجزأ: الدفعات المتزامنة وحذف الجلسات بعد حفظ الطلب
+"""
+import io
+import os
+import threading
+import time
+
+import pytest
+
+from app import db
+from services import upload_sessions
+from services.upload_sessions import UploadError
+
+
+@pytest.fixture
+def sessions_dir(ctx):
+    return upload_sessions.SESSIONS_DIR
+
+
+class SlowStream(io.BytesIO):
+    """تدفق بطيء ليتداخل طلبان على نفس الدفعة"""
+
+    def read(self, size=-1):
+        time.sleep(0.05)
+        return super().read(size)
+
+
+def _completed_upload(user_id, data=b'%PDF-1.4 test'):
+    upload_id = upload_sessions.start_upload(user_id, 'doc.pdf', len(data))['upload_id']
+    upload_sessions.append_chunk(upload_id, user_id, 0, io.BytesIO(data), len(data))
+    upload_sessions.complete_upload(upload_id, user_id)
+    return upload_id
+
+
+def test_concurrent_chunks_for_same_offset_are_serialized(sessions_dir, admin):
+    data = b'x' * 1000
+    upload_id = upload_sessions.start_upload(admin.id, 'doc.pdf', len(data) * 2)['upload_id']
+    outcomes = []
+
+    def send():
+        try:
+            outcomes.append(upload_sessions.append_chunk(upload_id, admin.id, 0, SlowStream(data), len(data)))
+        except UploadError as e:
+            outcomes.append(e.status)
+
+    threads = [threading.Thread(target=send) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(outcomes) == [409, len(data)]
+    assert upload_sessions.upload_status(upload_id, admin.id)['offset'] == len(data)
+
+
+def test_claimed_sessions_are_removed_only_after_commit(sessions_dir, admin):
+    upload_id = _completed_upload(admin.id)
+
+    assert len(upload_sessions.claim_uploads([upload_id], admin.id)) == 1
+    db.session.rollback()
+    # حفظ النموذج فشل: الجلسة باقية ليعاد إرساله بنفس المعرف
+    assert upload_sessions.upload_status(upload_id, admin.id)['completed']
+
+    assert len(upload_sessions.claim_uploads([upload_id], admin.id)) == 1
+    assert os.listdir(sessions_dir)
+    db.session.commit()
+    assert os.listdir(sessions_dir) == []
+
+
+def test_checklist_form_uploads_attachments_in_chunks(sessions_dir, client):
+    from models import Vehicle
+
+    vehicle = Vehicle(plate_number='ا ب ج 1234', make='تويوتا', model='هايلكس', year=2022, color='أبيض',
+                      type_of_car='بيك أب')
+    db.session.add(vehicle)
+    db.session.commit()
+    page = client.get(f'/mobile/vehicles/{vehicle.id}/handover/create').get_data(as_text=True)
+    assert 'js/chunked_upload.js' in page and 'upload_ids' in page
+
+    # نفس تسلسل ChunkedUploader: بدء، دفعات بالإزاحة، استئناف بعد تعارض، ثم إنهاء
+    data = b'%PDF-1.4 ' + b'x' * 3000
+    headers = {'X-CSRFToken': 'token'}
+    started = client.post('/mobile/uploads', json={'filename': 'report.pdf', 'size': len(data)}, headers=headers)
+    assert started.status_code == 201
+    url = f"/mobile/uploads/{started.get_json()['upload_id']}"
+
+    first = client.put(url, data=data[:1000], headers={**headers, 'Upload-Offset': '0'})
+    assert first.headers['Upload-Offset'] == '1000'
+    repeated = client.put(url, data=data[:1000], headers={**headers, 'Upload-Offset': '0'})
+    assert (repeated.status_code, repeated.headers['Upload-Offset']) == (409, '1000')
+    client.put(url, data=data[1000:], headers={**headers, 'Upload-Offset': '1000'})
+
+    completed = client.post(f'{url}/complete', headers=headers).get_json()
+    assert completed['success'] and completed['path'].startswith('static/uploads/blobs/')
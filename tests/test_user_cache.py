@@ -0,0 +1,51 @@
+"""
+ذاكرة المستخدمين: بدون استعلام بين الطلبات، وإعادة التحميل بعد حفظ أي تعديل فقط
+"""
+import pytest
+
+from app import db
+from models import Module, Permission, User, UserPermission
+from services import user_cache
+
+
+@pytest.fixture
+def cache(admin):
+    user_cache.invalidate()
+    yield user_cache
+    user_cache.invalidate()
+
+
+def _request(user_id):
+    """طلب جديد: جلسة فارغة ثم تحميل المستخدم كما يفعل user_loader"""
+    db.session.expunge_all()
+    return user_cache.load(user_id)
+
+
+def test_user_is_served_from_cache_until_it_changes(cache, admin):
+    _request(admin.id)
+    hits = cache.stats()['hits']
+
+    assert _request(admin.id).name == admin.name
+    assert cache.stats()['hits'] == hits + 1
+
+    db.session.get(User, admin.id).name = 'مدير جديد'
+    db.session.commit()
+
+    assert _request(admin.id).name == 'مدير جديد'
+    assert cache.stats()['hits'] == hits + 1
+
+
+def test_permissions_reload_after_commit_not_rollback(cache, admin):
+    db.session.add(UserPermission(user_id=admin.id, module=Module.EMPLOYEES, permissions=Permission.VIEW))
+    db.session.commit()
+    assert cache.permissions(_request(admin.id)) == {Module.EMPLOYEES: Permission.VIEW}
+    loads = cache.stats()['permission_loads']
+
+    db.session.add(UserPermission(user_id=admin.id, module=Module.SALARIES, permissions=Permission.VIEW))
+    db.session.rollback()
+    assert cache.permissions(_request(admin.id)) == {Module.EMPLOYEES: Permission.VIEW}
+    assert cache.stats()['permission_loads'] == loads
+
+    db.session.add(UserPermission(user_id=admin.id, module=Module.SALARIES, permissions=Permission.VIEW))
+    db.session.commit()
+    assert set(cache.permissions(_request(admin.id))) == {Module.EMPLOYEES, Module.SALARIES}
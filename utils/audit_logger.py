@@ -2,78 +2,81 @@
 نظام تسجيل العمليات والنشاطات في النظام
 """
 
-from flask import request
+from flask import request, has_request_context
 from flask_login import current_user
-from app import db
-from models import AuditLog
+from services import audit_writer
 import json
+import logging
 from datetime import datetime
 
+logger = logging.getLogger('audit')
 
-def log_activity(action, entity_type, entity_id=None, details=None, previous_data=None, new_data=None):
+
+def _request_info():
+    """عنوان IP ووكيل المستخدم للطلب الحالي إن وجد"""
+    if not has_request_context():
+        return 'Unknown', 'Unknown'
+    return (request.environ.get('HTTP_X_FORWARDED_FOR', request.environ.get('REMOTE_ADDR', 'Unknown')),
+            request.environ.get('HTTP_USER_AGENT', 'Unknown'))
+
+
+def _to_json(data):
+    if isinstance(data, (dict, list)):
+        return json.dumps(data, ensure_ascii=False, default=str)
+    return data
+
+
+def _record(user_id, action, entity_type, entity_id, details, previous_data, new_data):
+    ip_address, user_agent = _request_info()
+    audit_writer.record('audit_log', {
+        'user_id': user_id,
+        'action': action,
+        'entity_type': entity_type,
+        'entity_id': entity_id,
+        'details': details,
+        'ip_address': ip_address,
+        'user_agent': user_agent,
+        'previous_data': _to_json(previous_data),
+        'new_data': _to_json(new_data),
+        'timestamp': datetime.utcnow(),
+    })
+
+
+def log_activity(action, entity_type=None, entity_id=None, details=None, previous_data=None, new_data=None,
+                 user_id=None):
     """
     تسجيل نشاط في سجل المراجعة
     
+    السجل لا يُضاف إلى db.session ولا يحفظ شيئاً من معاملة المستدعي: يُجمع مع سجلات
+    الطلب ويُكتب دفعة واحدة بعد انتهائه (services.audit_writer).
+    
     :param action: نوع العملية (create, update, delete, view)
     :param entity_type: نوع الكيان (Employee, Department, Attendance, etc.)
     :param entity_id: معرف الكيان
     :param details: تفاصيل العملية
     :param previous_data: البيانات السابقة (للتحديث والحذف)
     :param new_data: البيانات الجديدة (للإنشاء والتحديث)
+    :param user_id: المستخدم (افتراضياً المستخدم الحالي)
     """
+    entity_type = entity_type or 'System'
     try:
-        # التحقق من وجود current_user والتأكد من أنه مسجل دخول أو النماذج الخارجية
-        user_id = None
-        if hasattr(current_user, 'is_authenticated') and current_user.is_authenticated and hasattr(current_user, 'id') and current_user.id:
-            user_id = current_user.id
-        elif 'external' in action or 'External' in entity_type:
-            # للنماذج الخارجية، استخدم user_id خاص للعمليات الخارجية
-            user_id = -1  # معرف خاص للعمليات الخارجية
+        if user_id is None:
+            # التحقق من وجود current_user والتأكد من أنه مسجل دخول أو النماذج الخارجية
+            if has_request_context() and getattr(current_user, 'is_authenticated', False) and getattr(current_user, 'id', None):
+                user_id = current_user.id
+            elif 'external' in action or 'External' in entity_type:
+                # للنماذج الخارجية، استخدم user_id خاص للعمليات الخارجية
+                user_id = -1  # معرف خاص للعمليات الخارجية
         
-        if user_id:
-            print(f"تسجيل عملية: {action} - {entity_type} - {details}")  # للتشخيص
-            
-            # تحويل البيانات إلى JSON إذا كانت قاموس
-            if isinstance(previous_data, dict):
-                previous_data = json.dumps(previous_data, ensure_ascii=False)
-            if isinstance(new_data, dict):
-                new_data = json.dumps(new_data, ensure_ascii=False)
-            
-            audit_log = AuditLog()
-            audit_log.user_id = user_id
-            audit_log.action = action
-            audit_log.entity_type = entity_type
-            audit_log.entity_id = entity_id
-            audit_log.details = details
-            
-            # التعامل الآمن مع request
-            try:
-                audit_log.ip_address = request.environ.get('HTTP_X_FORWARDED_FOR', request.environ.get('REMOTE_ADDR', 'Unknown'))
-                audit_log.user_agent = request.environ.get('HTTP_USER_AGENT', 'Unknown')
-            except:
-                audit_log.ip_address = 'Unknown'
-                audit_log.user_agent = 'Unknown'
-            
-            audit_log.previous_data = previous_data
-            audit_log.new_data = new_data
-            audit_log.timestamp = datetime.utcnow()
-            
-            db.session.add(audit_log)
-            db.session.commit()
-            print(f"تم تسجيل العملية بنجاح: {audit_log.id}")  # للتشخيص
-            
-        else:
-            print(f"لا يوجد مستخدم مسجل دخول - لم يتم تسجيل العملية: {action}")  # للتشخيص
+        if not user_id:
+            logger.debug("audit skipped (no user) action=%s entity=%s", action, entity_type)
+            return
+        
+        _record(user_id, action, entity_type, entity_id, details, previous_data, new_data)
             
-    except Exception as e:
-        print(f"خطأ في تسجيل النشاط: {e}")
-        import traceback
-        traceback.print_exc()  # طباعة التفاصيل الكاملة للخطأ
+    except Exception:
         # لا نريد أن يؤثر خطأ في التسجيل على العملية الأساسية
-        try:
-            db.session.rollback()
-        except:
-            pass
+        logger.exception("audit log_activity failed action=%s entity=%s", action, entity_type)
 
 
 def log_attendance_activity(action, attendance_data, employee_name=None):
@@ -215,40 +218,29 @@ def log_audit(user_id, action, entity_type, entity_id=None, details=None, previo
     :param new_data: البيانات الجديدة
     """
     try:
-        # تحويل البيانات إلى JSON إذا كانت قاموس
-        if isinstance(previous_data, dict):
-            previous_data = json.dumps(previous_data, ensure_ascii=False)
-        if isinstance(new_data, dict):
-            new_data = json.dumps(new_data, ensure_ascii=False)
-        
-        audit_log = AuditLog()
-        audit_log.user_id = user_id
-        audit_log.action = action
-        audit_log.entity_type = entity_type
-        audit_log.entity_id = entity_id
-        audit_log.details = details
-        
-        # التعامل الآمن مع request
-        try:
-            audit_log.ip_address = request.environ.get('HTTP_X_FORWARDED_FOR', request.environ.get('REMOTE_ADDR', 'Unknown'))
-            audit_log.user_agent = request.environ.get('HTTP_USER_AGENT', 'Unknown')
-        except:
-            audit_log.ip_address = 'Unknown'
-            audit_log.user_agent = 'Unknown'
-        
-        audit_log.previous_data = previous_data
-        audit_log.new_data = new_data
-        audit_log.timestamp = datetime.utcnow()
-        
-        db.session.add(audit_log)
-        db.session.commit()
-        print(f"تم تسجيل العملية بنجاح: {audit_log.id}")
-        
-    except Exception as e:
-        print(f"خطأ في تسجيل المراجعة: {e}")
-        import traceback
-        traceback.print_exc()
-        try:
-            db.session.rollback()
-        except:
-            pass
\ No newline at end of file
+        _record(user_id, action, entity_type, entity_id, details, previous_data, new_data)
+    except Exception:
+        logger.exception("audit log_audit failed action=%s entity=%s", action, entity_type)
+
+
+def log_system_audit(action, entity_type, entity_id, details=None, entity_name=None, user_id=None,
+                     previous_data=None, new_data=None):
+    """تسجيل في سجل عمليات النظام (SystemAudit) عبر نفس الكاتب المجمّع"""
+    try:
+        if user_id is None and has_request_context() and getattr(current_user, 'is_authenticated', False):
+            user_id = current_user.id
+        ip_address, _ = _request_info()
+        audit_writer.record('system_audit', {
+            'user_id': user_id,
+            'action': action,
+            'entity_type': entity_type,
+            'entity_id': entity_id or 0,
+            'entity_name': entity_name,
+            'details': details,
+            'previous_data': _to_json(previous_data),
+            'new_data': _to_json(new_data),
+            'ip_address': ip_address if ip_address != 'Unknown' else '127.0.0.1',
+            'timestamp': datetime.utcnow(),
+        })
+    except Exception:
+        logger.exception("audit log_system_audit failed action=%s entity=%s", action, entity_type)
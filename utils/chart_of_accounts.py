@@ -225,10 +225,21 @@ def calculate_account_balance(account_id, include_children=True):
         total_balance = account.balance
         
         if include_children:
-            # جلب جميع الحسابات الفرعية
-            children = Account.query.filter_by(parent_id=account_id, is_active=True).all()
-            for child in children:
-                total_balance += calculate_account_balance(child.id, True)
+            # كل الحسابات النشطة باستعلام واحد بدل استعلام لكل حساب فرعي
+            children = {}
+            for child_id, parent_id, balance in db.session.query(
+                Account.id, Account.parent_id, Account.balance
+            ).filter(Account.is_active == True, Account.parent_id.isnot(None)):
+                children.setdefault(parent_id, []).append((child_id, balance))
+            
+            pending = [account_id]
+            seen = {account_id}
+            while pending:
+                for child_id, balance in children.get(pending.pop(), ()):
+                    if child_id not in seen:
+                        seen.add(child_id)
+                        total_balance += balance or 0
+                        pending.append(child_id)
         
         return total_balance
         
@@ -6,9 +6,9 @@
 import os
 from datetime import datetime
 from fpdf import FPDF
-import arabic_reshaper
+from utils.lazy_imports import lazy_import
+arabic_reshaper = lazy_import('arabic_reshaper')
 from bidi.algorithm import get_display
-import pandas as pd
 from io import BytesIO
 from models import Employee, Attendance, Salary, Vehicle, Department
 
@@ -24,10 +24,7 @@ class EmployeeRequestsDriveUploader:
         return self.drive_service.is_configured()
     
     def get_or_create_requests_root_folder(self) -> Optional[str]:
-        """الحصول على مجلد 'نُظم - طلبات الموظفين' الرئيسي أو إنشاؤه"""
-        if self.requests_root_folder_id:
-            return self.requests_root_folder_id
-        
+        """الحصول على مجلد 'نُظم - طلبات الموظفين' الرئيسي أو إنشاؤه (المعرف من ذاكرة المجلدات المشتركة)"""
         try:
             # الحصول على مجلد نُظم الرئيسي
             root_folder_id = self.drive_service.get_root_folder()
@@ -50,6 +47,41 @@ class EmployeeRequestsDriveUploader:
             logger.error(f"خطأ في إنشاء مجلد طلبات الموظفين: {e}")
             return None
     
+    @staticmethod
+    def request_folder_path(
+        request_type: str,
+        request_id: int,
+        employee_name: str = None,
+        vehicle_number: str = None,
+        date: datetime = None
+    ) -> List[str]:
+        """
+        أسماء مجلدات الطلب من المجلد الرئيسي (تُستخدم أيضاً لقائمة المزامنة services/drive_sync.py)
+        
+        Returns:
+            [مجلد طلبات الموظفين، مجلد النوع، مجلد الطلب]
+        """
+        type_folder_names = {
+            'invoice': 'الفواتير',
+            'car_wash': 'طلبات غسيل السيارات',
+            'car_inspection': 'فحص وتوثيق السيارات',
+            'advance_payment': 'طلبات السلف'
+        }
+        type_folder_name = type_folder_names.get(request_type, 'طلبات أخرى')
+        
+        if date is None:
+            date = datetime.now()
+        date_str = date.strftime('%Y-%m-%d')
+        
+        if request_type in ['invoice', 'advance_payment']:
+            # للفواتير والسلف: رقم الطلب - اسم الموظف - التاريخ
+            folder_name = f"{request_id} - {employee_name} - {date_str}"
+        else:
+            # لطلبات السيارات: رقم الطلب - رقم السيارة - التاريخ
+            folder_name = f"{request_id} - {vehicle_number} - {date_str}"
+        
+        return ["طلبات الموظفين", type_folder_name, folder_name]
+    
     def create_request_folder(
         self, 
         request_type: str, 
@@ -77,15 +109,9 @@ class EmployeeRequestsDriveUploader:
             if not requests_root:
                 return None
             
-            # تحديد اسم المجلد الفرعي حسب النوع
-            type_folder_names = {
-                'invoice': 'الفواتير',
-                'car_wash': 'طلبات غسيل السيارات',
-                'car_inspection': 'فحص وتوثيق السيارات',
-                'advance_payment': 'طلبات السلف'
-            }
-            
-            type_folder_name = type_folder_names.get(request_type, 'طلبات أخرى')
+            _, type_folder_name, folder_name = self.request_folder_path(
+                request_type, request_id, employee_name, vehicle_number, date
+            )
             
             # الحصول على مجلد النوع أو إنشاؤه
             type_folder_id = self.drive_service._get_or_create_folder(
@@ -97,19 +123,6 @@ class EmployeeRequestsDriveUploader:
                 logger.error(f"فشل إنشاء مجلد النوع: {type_folder_name}")
                 return None
             
-            # تحديد التاريخ
-            if date is None:
-                date = datetime.now()
-            date_str = date.strftime('%Y-%m-%d')
-            
-            # تسمية المجلد حسب النوع
-            if request_type in ['invoice', 'advance_payment']:
-                # للفواتير والسلف: رقم الطلب - اسم الموظف - التاريخ
-                folder_name = f"{request_id} - {employee_name} - {date_str}"
-            else:
-                # لطلبات السيارات: رقم الطلب - رقم السيارة - التاريخ
-                folder_name = f"{request_id} - {vehicle_number} - {date_str}"
-            
             # إنشاء مجلد الطلب
             folder_id = self.drive_service._get_or_create_folder(
                 folder_name,
@@ -377,6 +390,8 @@ class EmployeeRequestsDriveUploader:
             
             if response.status_code == 204:
                 logger.info(f"تم حذف الملف: {file_id}")
+                from services import drive_cache
+                drive_cache.forget([file_id])
                 return True
             else:
                 logger.error(f"فشل حذف الملف: {response.status_code}")
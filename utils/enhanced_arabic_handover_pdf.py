@@ -5,13 +5,6 @@
 import os
 from io import BytesIO
 from datetime import datetime
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import A4
-from reportlab.lib import colors
-from reportlab.platypus import Table, TableStyle
-from reportlab.lib.units import inch
-from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.ttfonts import TTFont
 
 def safe_arabic_text(text):
     """
@@ -89,6 +82,11 @@ def create_vehicle_handover_pdf(handover_data):
     """
     إنشاء PDF محسن لتسليم المركبة بنصوص آمنة
     """
+    from reportlab.pdfgen import canvas
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib import colors
+    from reportlab.platypus import Table, TableStyle
+    from reportlab.lib.units import inch
     try:
         print("Starting enhanced Arabic handover PDF generation...")
         
@@ -1,10 +1,10 @@
-import pandas as pd
-import numpy as np
+from utils.lazy_imports import lazy_import
+pd = lazy_import('pandas')
+xlsxwriter = lazy_import('xlsxwriter')
 from io import BytesIO
 from datetime import datetime, timedelta
 from utils.date_converter import parse_date, format_date_gregorian, format_date_hijri
 from calendar import monthrange
-import xlsxwriter
 
 def parse_employee_excel(file):
     """
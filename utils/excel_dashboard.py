@@ -3,7 +3,8 @@
 """
 from io import BytesIO
 from datetime import timedelta
-import xlsxwriter
+from utils.lazy_imports import lazy_import
+xlsxwriter = lazy_import('xlsxwriter')
 
 
 def export_attendance_by_department_with_dashboard(employees, attendances, start_date, end_date=None):
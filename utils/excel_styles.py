@@ -0,0 +1,150 @@
+"""
+سجل الأنماط المسماة (Named Styles) المشتركة لملفات Excel
+
+تُعرَّف الخطوط والتعبئات والحدود مرة واحدة عند تحميل الوحدة، ثم تُسجَّل
+كأنماط مسماة في كل ملف يتم إنشاؤه بدلاً من إنشاء كائنات Font/PatternFill/Border
+جديدة لكل خلية في كل طلب تصدير.
+"""
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import NamedStyle, Font, PatternFill, Border, Side, Alignment
+
+
+# مجموعات الأنماط المسجلة: اسم المجموعة -> {اسم النمط: خصائصه}
+_STYLE_SHEETS = {}
+
+
+def solid_fill(color):
+    """تعبئة بلون واحد"""
+    return PatternFill(start_color=color, end_color=color, fill_type="solid")
+
+
+def box_border(color, style='thin'):
+    """حدود كاملة حول الخلية بنفس اللون"""
+    side = Side(style=style, color=color)
+    return Border(left=side, right=side, top=side, bottom=side)
+
+
+def define_style_sheet(sheet_name, styles):
+    """
+    تعريف مجموعة أنماط مسماة قابلة لإعادة الاستخدام
+
+    :param sheet_name: اسم المجموعة (مثال: 'powerbi')
+    :param styles: قاموس {اسم النمط: {'font': ..., 'fill': ..., 'border': ..., 'alignment': ...}}
+    """
+    _STYLE_SHEETS[sheet_name] = dict(styles)
+    return _STYLE_SHEETS[sheet_name]
+
+
+def use_style_sheet(workbook, sheet_name):
+    """
+    تسجيل أنماط المجموعة في ملف Excel (مرة واحدة لكل ملف)
+
+    :param workbook: كائن Workbook (عادي أو write-only)
+    :param sheet_name: اسم مجموعة الأنماط المعرفة مسبقاً
+    :return: قائمة أسماء الأنماط المسجلة
+    """
+    if sheet_name not in _STYLE_SHEETS:
+        raise KeyError(f"مجموعة الأنماط غير معرفة: {sheet_name}")
+
+    existing = set(workbook.named_styles)
+    for style_name, spec in _STYLE_SHEETS[sheet_name].items():
+        if style_name in existing:
+            continue
+        # كائن NamedStyle يرتبط بملف واحد فقط، لذلك يُنشأ لكل ملف
+        # بينما تبقى كائنات الخط والتعبئة والحدود مشتركة
+        workbook.add_named_style(NamedStyle(name=style_name, **spec))
+    return list(_STYLE_SHEETS[sheet_name])
+
+
+def styled_cell(worksheet, value, style=None):
+    """إنشاء خلية لورقة write-only مع نمط مسمى اختياري"""
+    cell = WriteOnlyCell(worksheet, value=value)
+    if style:
+        cell.style = style
+    return cell
+
+
+# ==================== أنماط لوحة Power BI ====================
+
+_CENTER = Alignment(horizontal='center', vertical='center')
+_CENTER_H = Alignment(horizontal='center')
+
+_DARK_BG = solid_fill("0A0E17")
+_CARD = solid_fill("131B2E")
+_CARD_ALT = solid_fill("1A2540")
+_HEADER = solid_fill("0D1321")
+
+_CYAN_BORDER_THIN = box_border('00D4FF')
+_THIN_BORDER = box_border('2D3748')
+_ACCENT_BORDER = Border(bottom=Side(style='medium', color='00D4FF'))
+
+_TITLE_FONT = Font(bold=True, color="00D4FF", size=28, name='Arial')
+_SUBTITLE_FONT = Font(color="8892A0", size=11, name='Arial')
+
+POWERBI_ACCENTS = {
+    'cyan': "00D4FF",
+    'teal': "00F5D4",
+    'green': "00FF88",
+    'red': "FF4757",
+    'orange': "FFD700",
+    'blue': "3B82F6",
+    'purple': "7B68EE",
+}
+
+POWERBI_BAR_COLORS = ("10B981", "FF4757", "3B82F6", "FFD700", "7B68EE")
+
+_powerbi_styles = {
+    'pbi_bg': {'fill': _DARK_BG},
+    'pbi_title': {'font': _TITLE_FONT, 'fill': _HEADER, 'alignment': _CENTER, 'border': _ACCENT_BORDER},
+    'pbi_subtitle': {'font': _SUBTITLE_FONT, 'fill': _CARD, 'alignment': _CENTER},
+    'pbi_note': {'font': Font(color="00F5D4", size=10, italic=True, name='Arial'), 'fill': _DARK_BG, 'alignment': _CENTER},
+    'pbi_card_alt': {'fill': _CARD_ALT},
+    'pbi_kpi_label': {'font': Font(bold=True, color="8892A0", size=11, name='Arial'), 'fill': _CARD,
+                      'alignment': _CENTER, 'border': _CYAN_BORDER_THIN},
+    'pbi_kpi_value': {'font': Font(bold=True, color="00D4FF", size=32, name='Arial'), 'fill': _CARD,
+                      'alignment': _CENTER, 'border': _CYAN_BORDER_THIN},
+    'pbi_section': {'font': Font(bold=True, color="00D4FF", size=16, name='Arial'), 'fill': _HEADER,
+                    'alignment': _CENTER, 'border': _ACCENT_BORDER},
+    'pbi_table_header': {'font': Font(bold=True, color="00D4FF", size=13, name='Arial'), 'fill': _CARD_ALT,
+                         'alignment': _CENTER, 'border': _CYAN_BORDER_THIN},
+    'pbi_row_label': {'font': Font(bold=True, color="FFFFFF", size=12, name='Arial'), 'fill': _CARD,
+                      'alignment': _CENTER, 'border': _THIN_BORDER},
+    'pbi_row_text': {'font': Font(color="E8EAED", size=11, name='Arial'), 'fill': _CARD,
+                     'alignment': _CENTER, 'border': _THIN_BORDER},
+    'pbi_row_count': {'font': Font(bold=True, color="00D4FF", size=14, name='Arial'), 'fill': _CARD,
+                      'alignment': _CENTER, 'border': _THIN_BORDER},
+    'pbi_row_number': {'font': Font(bold=True, color="00D4FF", size=12, name='Arial'), 'fill': _CARD,
+                       'alignment': _CENTER, 'border': _THIN_BORDER},
+    'pbi_row_pct': {'font': Font(bold=True, color="00F5D4", size=12, name='Arial'), 'fill': _CARD,
+                    'alignment': _CENTER, 'border': _THIN_BORDER},
+    'pbi_row_pct_warn': {'font': Font(bold=True, color="FFD700", size=12, name='Arial'), 'fill': _CARD,
+                         'alignment': _CENTER, 'border': _THIN_BORDER},
+    'pbi_row_rate': {'font': Font(bold=True, color="FFFFFF", size=12, name='Arial'), 'fill': _CARD,
+                     'alignment': _CENTER, 'border': _THIN_BORDER},
+
+    # تفاصيل الأوراق الفرعية
+    'pbi_detail_title': {'font': _TITLE_FONT, 'alignment': _CENTER},
+    'pbi_detail_subtitle': {'font': _SUBTITLE_FONT, 'alignment': _CENTER},
+    'pbi_detail_header': {'font': Font(bold=True, color="00D4AA", size=12), 'fill': solid_fill("1F2937"),
+                          'border': _THIN_BORDER, 'alignment': _CENTER},
+    'pbi_detail_header_dark': {'font': Font(bold=True, color="00D4AA", size=12), 'fill': _HEADER,
+                               'border': _THIN_BORDER, 'alignment': _CENTER},
+    'pbi_detail_cell': {'border': _THIN_BORDER, 'alignment': _CENTER_H},
+    'pbi_detail_alt': {'fill': solid_fill("F3F4F6"), 'border': _THIN_BORDER, 'alignment': _CENTER_H},
+    'pbi_detail_success': {'fill': solid_fill("D1FAE5"), 'border': _THIN_BORDER, 'alignment': _CENTER_H},
+    'pbi_detail_warning': {'fill': solid_fill("FEF3C7"), 'border': _THIN_BORDER, 'alignment': _CENTER_H},
+    'pbi_detail_danger': {'fill': solid_fill("FEE2E2"), 'border': _THIN_BORDER, 'alignment': _CENTER_H},
+    'pbi_detail_info': {'fill': solid_fill("DBEAFE"), 'border': _THIN_BORDER, 'alignment': _CENTER_H},
+}
+
+for _name, _color in POWERBI_ACCENTS.items():
+    _powerbi_styles[f'pbi_accent_{_name}'] = {'fill': solid_fill(_color)}
+    _powerbi_styles[f'pbi_rating_{_name}'] = {'font': Font(bold=True, color="0A0E17", size=12, name='Arial'),
+                                              'fill': solid_fill(_color), 'alignment': _CENTER,
+                                              'border': _THIN_BORDER}
+
+for _color in POWERBI_BAR_COLORS:
+    _powerbi_styles[f'pbi_bar_{_color}'] = {'font': Font(color=_color, size=12, name='Arial'), 'fill': _CARD,
+                                            'alignment': _CENTER, 'border': _THIN_BORDER}
+
+define_style_sheet('powerbi', _powerbi_styles)
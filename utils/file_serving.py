@@ -0,0 +1,191 @@
+"""
+خدمة تقديم الملفات المرفوعة
+
+- ذاكرة LRU لمسارات الملفات المحلولة بدلاً من فحص عدة مجلدات في كل طلب
+- ETag قوي وطلبات شرطية (If-None-Match / If-Modified-Since) ترجع 304
+- ترويسات Cache-Control طويلة وغير قابلة للتغيير لملفات مخزن الملفات (blobs/) ونسخها
+  المصغرة، إلا إذا أُرسل الأصل بدلاً من نسخة مصغرة لم تُنشأ بعد (مدة قصيرة حتى تظهر
+  النسخة). الأسماء العشوائية (uuid) خارج المخزن قد تُعدّل في مكانها (submit_image)،
+  فتأخذ ETag من وقت التعديل والحجم ومدة UPLOADS_CACHE_MAX_AGE
+- دعم HTTP Range لملفات PDF والفيديو عبر send_file
+- تفويض الإرسال للخادم الأمامي عبر X-Sendfile أو X-Accel-Redirect عند تفعيله
+
+الإعدادات (app.config):
+    USE_X_SENDFILE            تفعيل X-Sendfile (Apache / lighttpd)
+    UPLOADS_ACCEL_REDIRECT    بادئة الموقع الداخلي في nginx (مثال: /_protected/)
+    UPLOADS_CACHE_MAX_AGE     مدة التخزين المؤقت للملفات العادية بالثواني
+"""
+import mimetypes
+import os
+import threading
+from collections import OrderedDict
+
+from flask import current_app, request, send_file, make_response
+from werkzeug.security import safe_join
+
+# عدد المسارات المحفوظة في الذاكرة
+PATH_CACHE_SIZE = 4096
+
+# سنة كاملة للملفات التي يتغير اسمها بتغير محتواها
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+DEFAULT_MAX_AGE = 3600
+# الملف المرسل بديل مؤقت عما يسميه الرابط (?size=thumb قبل إنشاء النسخة المصغرة)
+PROVISIONAL_MAX_AGE = 60
+
+_path_cache = OrderedDict()
+_path_cache_lock = threading.Lock()
+
+
+def _cache_get(key):
+    with _path_cache_lock:
+        path = _path_cache.get(key)
+        if path is not None:
+            _path_cache.move_to_end(key)
+        return path
+
+
+def _cache_put(key, path):
+    with _path_cache_lock:
+        _path_cache[key] = path
+        _path_cache.move_to_end(key)
+        while len(_path_cache) > PATH_CACHE_SIZE:
+            _path_cache.popitem(last=False)
+
+
+def invalidate_path(filename=None):
+    """حذف مسار (أو كل المسارات) من الذاكرة المؤقتة، يُستدعى بعد حذف الملفات"""
+    with _path_cache_lock:
+        if filename is None:
+            _path_cache.clear()
+            return
+        for key in [key for key in _path_cache if key[1] == filename]:
+            del _path_cache[key]
+
+
+def resolve_file(filename, roots):
+    """
+    إيجاد الملف في أول مجلد يحتويه مع حفظ النتيجة
+
+    :param filename: المسار النسبي المطلوب
+    :param roots: المجلدات المراد البحث فيها بالترتيب
+    :return: (المسار المطلق، المجلد الذي وُجد فيه، نتيجة os.stat) أو None
+    """
+    key = (tuple(roots), filename)
+    cached = _cache_get(key)
+    if cached is not None:
+        root, path = cached
+        try:
+            return path, root, os.stat(path)
+        except OSError:
+            # الملف حُذف أو نُقل؛ إعادة البحث
+            invalidate_path(filename)
+
+    for root in roots:
+        path = safe_join(os.path.abspath(root), filename)
+        if path is None:
+            # محاولة الخروج من المجلد المسموح
+            return None
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        if not os.path.isfile(path):
+            continue
+        _cache_put(key, (root, path))
+        return path, root, stat
+    return None
+
+
+def is_content_addressed(filename):
+    """
+    التحقق من كون الملف في مخزن الملفات (اسمه بصمة محتواه ولا يُعدّل) أو نسخة مصغرة منه
+
+    :param filename: المسار النسبي لمجلد الرفع (blobs/ab/cd/<sha256>.jpg) أو المسار المخزن
+    """
+    from services.blob_store import BlobStore
+    from utils.image_pipeline import VARIANT_SIZES
+
+    path = filename.replace('\\', '/').lstrip('/')
+    if not path.startswith(('static/uploads/', 'uploads/')):
+        path = 'uploads/' + path
+    base, extension = os.path.splitext(path)
+    stem, size = os.path.splitext(base)
+    if extension == '.webp' and size[1:] in VARIANT_SIZES:
+        # photo.thumb.webp: النسخة المصغرة تتبع أصلها
+        path = stem + extension
+    return BlobStore.parse_path(path) is not None
+
+
+def _etag_for(filename, stat):
+    """ETag قوي: اسم الملف للملفات المعتمدة على المحتوى، وإلا وقت التعديل والحجم"""
+    if is_content_addressed(filename):
+        # الاسم كاملاً وليس البصمة فقط، لتختلف النسخ المصغرة (hash.thumb.webp) عن الأصل
+        return os.path.basename(filename).lower()
+    return f"{stat.st_mtime_ns:x}-{stat.st_size:x}"
+
+
+def _apply_cache_headers(response, filename, provisional=False):
+    response.cache_control.no_cache = None
+    if provisional:
+        # لا immutable: الرابط نفسه سيُرجع النسخة المصغرة عند توفرها
+        response.cache_control.max_age = PROVISIONAL_MAX_AGE
+    elif is_content_addressed(filename):
+        response.cache_control.max_age = IMMUTABLE_MAX_AGE
+        response.cache_control.immutable = True
+    else:
+        response.cache_control.max_age = current_app.config.get('UPLOADS_CACHE_MAX_AGE', DEFAULT_MAX_AGE)
+    # الملفات المرفوعة قد تحتوي بيانات موظفين، فلا تُخزن في الوسطاء المشتركين
+    response.cache_control.private = True
+    response.cache_control.public = False
+    return response
+
+
+def send_resolved_file(path, root, stat, filename, provisional=False):
+    """إرسال ملف محلول مع ETag وترويسات التخزين المؤقت ودعم Range"""
+    etag = _etag_for(filename, stat)
+
+    accel_prefix = current_app.config.get('UPLOADS_ACCEL_REDIRECT')
+    if accel_prefix:
+        # nginx يتولى الإرسال (بما في ذلك Range)؛ نرد 304 بأنفسنا لتوفير الطلب الداخلي
+        response = make_response('')
+        response.set_etag(etag)
+        response.last_modified = stat.st_mtime
+        response.make_conditional(request)
+        if response.status_code != 304:
+            internal = f"{accel_prefix.rstrip('/')}/{root.strip('/')}/{filename}"
+            response.headers['X-Accel-Redirect'] = internal
+            response.headers.pop('Content-Length', None)
+        response.mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        return _apply_cache_headers(response, filename, provisional)
+
+    # send_file يتولى Range و304 و X-Sendfile حسب USE_X_SENDFILE
+    response = send_file(
+        path,
+        conditional=True,
+        etag=etag,
+        last_modified=stat.st_mtime,
+        max_age=None,
+    )
+    return _apply_cache_headers(response, filename, provisional)
+
+
+def serve_upload(filename, roots, fallback=None, provisional=False):
+    """
+    تقديم ملف مرفوع من أول مجلد يحتويه
+
+    :param filename: المسار النسبي المطلوب
+    :param roots: المجلدات المراد البحث فيها بالترتيب
+    :param fallback: دالة تُستدعى باسم الملف عند عدم وجوده محلياً، تنزله إلى مجلد محلي
+                     وتعيد ذلك المجلد (أو None)
+    :param provisional: الملف بديل عما يطلبه الرابط (الأصل بدل نسخة مصغرة)، فيُخزن مؤقتاً لمدة قصيرة
+    :return: استجابة Flask أو None إذا لم يوجد الملف
+    """
+    resolved = resolve_file(filename, roots)
+    if resolved is None and fallback is not None:
+        cache_root = fallback(filename)
+        if cache_root:
+            resolved = resolve_file(filename, (cache_root,))
+    if resolved is None:
+        return None
+    path, root, stat = resolved
+    return send_resolved_file(path, root, stat, filename, provisional)
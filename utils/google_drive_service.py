@@ -79,7 +79,17 @@ class GoogleDriveService:
             return False
     
     def _get_or_create_folder(self, folder_name: str, parent_id: Optional[str] = None) -> Optional[str]:
-        """الحصول على مجلد أو إنشاؤه إذا لم يكن موجوداً - مع دعم Shared Drive"""
+        """الحصول على مجلد أو إنشاؤه إذا لم يكن موجوداً - مع دعم Shared Drive
+        
+        المعرف يُقرأ أولاً من ذاكرة المجلدات المشتركة (services/drive_cache.py) ويُحفظ فيها بعد البحث
+        """
+        from services import drive_cache
+        
+        parent_id = parent_id or self.shared_drive_id
+        cached_id = drive_cache.get_folder(self.shared_drive_id, parent_id, folder_name)
+        if cached_id:
+            return cached_id
+        
         try:
             from google.oauth2 import service_account
             from googleapiclient.discovery import build
@@ -115,6 +125,7 @@ class GoogleDriveService:
             files = results.get('files', [])
             if files:
                 logger.info(f"✅ وجد المجلد الموجود: {folder_name}")
+                drive_cache.put_folder(self.shared_drive_id, parent_id, folder_name, files[0]['id'])
                 return files[0]['id']
             
             # إنشاء المجلد إذا لم يكن موجوداً
@@ -131,6 +142,8 @@ class GoogleDriveService:
             ).execute()
             
             logger.info(f"✅ تم إنشاء المجلد: {folder_name} (ID: {folder.get('id')})")
+            if folder.get('id'):
+                drive_cache.put_folder(self.shared_drive_id, parent_id, folder_name, folder.get('id'))
             return folder.get('id')
                 
         except Exception as e:
@@ -219,6 +232,8 @@ class GoogleDriveService:
                     logger.warning(f"⚠️ خطأ في الرفع، إعادة محاولة {retry_count}: {str(e)[:100]}")
             
             logger.info(f"✅ تم رفع الملف بنجاح: {file_name} (ID: {response.get('id')})")
+            from services import drive_cache
+            drive_cache.put_files(self.shared_drive_id, [response], parent_id=folder_id)
             return {
                 'file_id': response.get('id'),
                 'file_name': response.get('name'),
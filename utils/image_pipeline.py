@@ -0,0 +1,204 @@
+"""
+خط معالجة الصور المرفوعة
+
+- تصحيح الاتجاه حسب بيانات EXIF (صور الجوال)
+- تحديد حد أقصى لأبعاد الصورة الأصلية
+- إنشاء نسخ مصغرة بصيغة WebP بجانب الملف الأصلي:
+    photo.jpg -> photo.thumb.webp / photo.medium.webp
+- تنفيذ المعالجة في مجموعة عمال خلفية بدلاً من خيط الطلب
+
+القوالب تطلب النسخة المناسبة عبر الفلتر:
+    {{ url_for('static', filename=image.image_path|image_variant('thumb')) }}
+وإذا لم تكن النسخة جاهزة بعد يُرجع المسار الأصلي.
+"""
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image, ImageOps
+
+try:
+    from pillow_heif import register_heif_opener
+    register_heif_opener()
+except ImportError:
+    pass
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = {'jpg', 'jpeg', 'png', 'gif', 'webp', 'heic', 'heif', 'bmp'}
+
+# الحد الأقصى لأبعاد الصورة الأصلية
+MAX_IMAGE_DIMENSION = 1920
+
+# أحجام النسخ المصغرة (أطول ضلع بالبكسل)
+VARIANT_SIZES = {
+    'thumb': 320,
+    'medium': 1024,
+}
+VARIANT_QUALITY = 80
+
+_executor = ThreadPoolExecutor(
+    max_workers=int(os.environ.get('IMAGE_WORKERS', 2)),
+    thread_name_prefix='image-pipeline'
+)
+
+
+def is_image_path(path):
+    """التحقق من كون المسار لصورة حسب الامتداد"""
+    return '.' in path and path.rsplit('.', 1)[1].lower() in IMAGE_EXTENSIONS
+
+
+def variant_name(path, size):
+    """اسم ملف النسخة المصغرة: photo.jpg -> photo.thumb.webp"""
+    return f"{os.path.splitext(path)[0]}.{size}.webp"
+
+
+def _to_rgb(img):
+    """تحويل الصورة إلى RGB مع تسطيح الشفافية على خلفية بيضاء"""
+    if img.mode == 'RGB':
+        return img
+    if img.mode == 'P':
+        img = img.convert('RGBA')
+    if img.mode in ('RGBA', 'LA'):
+        background = Image.new('RGB', img.size, (255, 255, 255))
+        background.paste(img, mask=img.split()[-1])
+        return background
+    return img.convert('RGB')
+
+
+def _save_atomic(img, path, fmt, **options):
+    """الحفظ إلى ملف مؤقت ثم الاستبدال حتى لا يُقرأ ملف نصف مكتوب"""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        img.save(tmp_path, fmt, **options)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def optimize_image(path, max_size=MAX_IMAGE_DIMENSION, quality=85, to_jpeg=False):
+    """
+    تصحيح الاتجاه وتصغير الصورة الأصلية في مكانها
+
+    :param path: مسار الصورة على القرص
+    :param max_size: أقصى طول لأي ضلع
+    :param quality: جودة JPEG
+    :param to_jpeg: إعادة ترميز الصورة كـ JPEG دائماً (مع الإبقاء على اسم الملف)
+    :return: True عند النجاح
+    """
+    try:
+        with Image.open(path) as original:
+            if getattr(original, 'is_animated', False):
+                return True
+
+            source_format = original.format
+            img = ImageOps.exif_transpose(original)
+            changed = img is not original
+            if img.width > max_size or img.height > max_size:
+                if img is original:
+                    img = original.copy()
+                img.thumbnail((max_size, max_size), Image.Resampling.LANCZOS)
+                changed = True
+
+            if to_jpeg or source_format in ('JPEG', 'MPO'):
+                if changed or to_jpeg or source_format != 'JPEG':
+                    _save_atomic(_to_rgb(img), path, 'JPEG', quality=quality, optimize=True)
+            elif changed:
+                _save_atomic(img, path, source_format, optimize=True)
+        return True
+    except Exception as e:
+        logger.error(f"خطأ في تحسين الصورة {path}: {str(e)}")
+        return False
+
+
+def generate_variants(path, sizes=None):
+    """إنشاء النسخ المصغرة بصيغة WebP بجانب الصورة الأصلية"""
+    sizes = sizes or VARIANT_SIZES
+    variants = {}
+    try:
+        with Image.open(path) as original:
+            img = ImageOps.exif_transpose(original)
+            if img.mode not in ('RGB', 'RGBA'):
+                img = img.convert('RGBA' if 'A' in img.getbands() or img.mode == 'P' else 'RGB')
+
+            # من الأكبر إلى الأصغر لتقليل كلفة التصغير
+            for size_name, dimension in sorted(sizes.items(), key=lambda item: -item[1]):
+                if img.width > dimension or img.height > dimension:
+                    img = img.copy()
+                    img.thumbnail((dimension, dimension), Image.Resampling.LANCZOS)
+                target = variant_name(path, size_name)
+                _save_atomic(img, target, 'WEBP', quality=VARIANT_QUALITY, method=4)
+                variants[size_name] = target
+    except Exception as e:
+        logger.error(f"خطأ في إنشاء النسخ المصغرة للصورة {path}: {str(e)}")
+    return variants
+
+
+def process_image(path, max_size=MAX_IMAGE_DIMENSION, quality=85, to_jpeg=False):
+    """المعالجة الكاملة: تحسين الأصل ثم إنشاء النسخ المصغرة"""
+    if not os.path.exists(path) or not is_image_path(path):
+        return {}
+    optimize_image(path, max_size=max_size, quality=quality, to_jpeg=to_jpeg)
+    return generate_variants(path)
+
+
+def submit_image(path, max_size=MAX_IMAGE_DIMENSION, quality=85, to_jpeg=False):
+    """
+    جدولة معالجة صورة في الخلفية
+
+    يُستدعى بعد حفظ الملف في مكانه النهائي؛ الطلب لا ينتظر انتهاء المعالجة.
+    لا يُستخدم لملفات مخزن الملفات (انظر submit_variants).
+    """
+    if not path or not is_image_path(path):
+        return None
+    return _executor.submit(process_image, path, max_size, quality, to_jpeg)
+
+
+def submit_variants(path):
+    """
+    جدولة إنشاء النسخ المصغرة فقط دون تعديل الأصل
+
+    لملفات مخزن الملفات (services/blob_store.py): اسم الملف بصمة محتواه فلا يُعدّل بعد
+    تخزينه، والتحسين يتم قبل التخزين (BlobStore.save_image).
+    """
+    if not path or not is_image_path(path):
+        return None
+    return _executor.submit(generate_variants, path)
+
+
+def submit_images(paths, **options):
+    """جدولة معالجة مجموعة صور، كل صورة كمهمة مستقلة"""
+    return [future for future in (submit_image(path, **options) for path in paths) if future]
+
+
+def _resolve_on_disk(path):
+    """إيجاد الملف على القرص للمسارات المخزنة بأشكالها المختلفة"""
+    candidates = (
+        path,
+        os.path.join('static', path),
+        os.path.join('static', 'uploads', path),
+        os.path.join('uploads', path),
+    )
+    for candidate in candidates:
+        if os.path.isfile(candidate):
+            return candidate
+    return None
+
+
+def variant_path(path, size):
+    """
+    إرجاع مسار النسخة المطلوبة بنفس صيغة المسار المخزن، أو الأصل إن لم تتوفر
+
+    :param path: المسار كما هو مخزن في قاعدة البيانات (مثال: uploads/workshop/x.jpg)
+    :param size: 'thumb' أو 'medium'
+    """
+    if not path or size not in VARIANT_SIZES or not is_image_path(path):
+        return path
+    candidate = variant_name(path, size)
+    return candidate if _resolve_on_disk(candidate) else path
+
+
+def register_template_filters(app):
+    """تسجيل فلتر image_variant في القوالب"""
+    app.add_template_filter(variant_path, 'image_variant')
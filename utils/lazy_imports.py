@@ -0,0 +1,115 @@
+"""
+تحميل المكتبات الثقيلة عند أول استخدام
+
+كل عامل gunicorn كان يستورد pandas و numpy و openpyxl و xlsxwriter ومكتبات PDF عند
+استيراد وحدات المسارات، رغم أن أغلب الطلبات لا تستخدمها. lazy_import() يعيد وحدة وسيطة
+لا تستورد المكتبة الحقيقية إلا عند أول وصول لخاصية منها:
+
+    from utils.lazy_imports import lazy_import
+    pd = lazy_import('pandas')
+    ...
+    df = pd.DataFrame(rows)   # هنا فقط تُستورد pandas
+
+الاستيراد بصيغة from X import Y لمولدات PDF و Excel يُنقل إلى داخل الدوال التي تستخدمها.
+قياس كلفة الاستيراد لكل وحدة: flask importtime
+"""
+import importlib
+import os
+import subprocess
+import sys
+import threading
+import types
+
+# مكتبات يجب ألا تُستورد عند إقلاع العامل (يُنبه إليها flask importtime)
+HEAVY_MODULES = ('pandas', 'numpy', 'openpyxl', 'xlsxwriter', 'fpdf', 'reportlab', 'openai', 'weasyprint')
+
+_lock = threading.RLock()
+
+
+class LazyModule(types.ModuleType):
+    """وحدة وسيطة تستورد الوحدة الحقيقية عند أول وصول لخاصية منها"""
+
+    def __init__(self, name):
+        super().__init__(name)
+        self.__dict__['_lazy_module'] = None
+
+    def _load(self):
+        module = self.__dict__['_lazy_module']
+        if module is None:
+            with _lock:
+                module = self.__dict__['_lazy_module']
+                if module is None:
+                    module = importlib.import_module(self.__name__)
+                    self.__dict__['_lazy_module'] = module
+        return module
+
+    def __getattr__(self, attr):
+        module = self._load()
+        try:
+            value = getattr(module, attr)
+        except AttributeError:
+            # الوحدات الفرعية غير المستوردة بعد (مثل openpyxl.utils)
+            try:
+                value = importlib.import_module(f"{self.__name__}.{attr}")
+            except ImportError:
+                raise AttributeError(f"module {self.__name__!r} has no attribute {attr!r}") from None
+        return value
+
+    def __dir__(self):
+        return dir(self._load())
+
+    def __repr__(self):
+        state = 'loaded' if self.__dict__['_lazy_module'] is not None else 'not loaded'
+        return f"<lazy module {self.__name__!r} ({state})>"
+
+
+def lazy_import(name):
+    """
+    وحدة name تُستورد عند أول استخدام
+
+    إذا كانت الوحدة مستوردة مسبقاً تُعاد مباشرة.
+    """
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    return LazyModule(name)
+
+
+def import_profile(target='app'):
+    """
+    قياس كلفة استيراد target في عملية جديدة (python -X importtime)
+
+    المجدول لا يبدأ في العملية المقاسة (SCHEDULER_ENABLED=0).
+    :return: dict فيه total_ms، و modules [(الوحدة، الذاتي ms، التراكمي ms)] مرتبة بالتراكمي،
+             و packages {الحزمة العليا: الذاتي ms}، و heavy (المكتبات الثقيلة المستوردة)،
+             و max_rss_mb ذاكرة العملية المقاسة
+    """
+    import resource
+
+    env = dict(os.environ, SCHEDULER_ENABLED='0')
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f"import {target}"],
+                            env=env, capture_output=True, text=True)
+    max_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr.strip() else 'import failed')
+
+    modules = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        modules.append((name.strip(), int(self_us) / 1000, int(cumulative_us) / 1000))
+
+    packages = {}
+    for name, self_ms, _ in modules:
+        top = name.split('.')[0]
+        packages[top] = packages.get(top, 0) + self_ms
+    imported = {name for name, _, _ in modules}
+    return {
+        'total_ms': next((cumulative for name, _, cumulative in modules if name == target), 0),
+        'modules': sorted(modules, key=lambda item: item[2], reverse=True),
+        'packages': packages,
+        'heavy': [name for name in HEAVY_MODULES if name in imported],
+        # ru_maxrss بالكيلوبايت في لينكس
+        'max_rss_mb': max_rss / 1024,
+    }
@@ -2,16 +2,61 @@
 وحدة إنشاء ملفات PDF باستخدام ReportLab مع دعم للغة العربية
 """
 import os
+import logging
 from io import BytesIO
-from reportlab.lib.pagesizes import A4, landscape
-from reportlab.lib import colors
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
-from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.ttfonts import TTFont
-from reportlab.lib.units import cm
-import arabic_reshaper
-from bidi.algorithm import get_display
+from utils.lazy_imports import lazy_import
+arabic_reshaper = lazy_import('arabic_reshaper')
+
+logger = logging.getLogger(__name__)
+
+# الخطوط العربية المشتركة بين التقارير (الاسم المسجل: المسار)
+SHARED_FONTS = {
+    'Amiri': 'static/fonts/Amiri-Regular.ttf',
+    'Amiri-Bold': 'static/fonts/Amiri-Bold.ttf',
+    'AmiriBold': 'static/fonts/Amiri-Bold.ttf',
+    'ArabicFont': 'static/fonts/Amiri-Regular.ttf',
+    'ArabicFontBold': 'static/fonts/Amiri-Bold.ttf',
+    'Cairo': 'Cairo.ttf',
+}
+
+_registered_fonts = {}
+
+
+def register_font(name, path):
+    """
+    تسجيل خط TrueType في ReportLab مرة واحدة لكل (اسم، مسار)
+
+    إنشاء TTFont يحلل ملف الخط كاملاً، فتسجيله في كل طلب يكرر التحليل. مع التحميل المسبق
+    (services/preload.py) تُسجل SHARED_FONTS في العملية الرئيسية ويتشاركها العمال.
+    """
+    from reportlab.pdfbase import pdfmetrics
+    from reportlab.pdfbase.ttfonts import TTFont
+
+    registered = _registered_fonts.get(name)
+    if registered is not None and registered[0] == path:
+        try:
+            if pdfmetrics.getFont(name) is registered[1]:
+                return
+        except KeyError:
+            pass
+    font = TTFont(name, path)
+    pdfmetrics.registerFont(font)
+    _registered_fonts[name] = (path, font)
+
+
+def preload_fonts():
+    """تسجيل الخطوط المشتركة مسبقاً؛ يعيد أسماء الخطوط المسجلة"""
+    loaded = []
+    for name, path in SHARED_FONTS.items():
+        if not os.path.exists(path):
+            continue
+        try:
+            register_font(name, path)
+            loaded.append(name)
+        except Exception as e:
+            logger.warning(f"تعذر تسجيل الخط {name} ({path}): {e}")
+    return loaded
+
 
 # تسجيل الخطوط المستخدمة
 def register_fonts():
@@ -23,6 +68,8 @@ def register_fonts():
 # إنشاء الأنماط للتقارير
 def get_styles():
     """الحصول على أنماط النصوص للتقارير"""
+    from reportlab.lib import colors
+    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
     styles = getSampleStyleSheet()
     
     # إنشاء نمط للنص العربي
@@ -72,6 +119,7 @@ def arabic_text(text):
     Returns:
         النص بعد المعالجة
     """
+    from bidi.algorithm import get_display
     if not text:
         return ""
     
@@ -91,6 +139,9 @@ def create_pdf(elements, landscape_mode=False):
     Returns:
         BytesIO يحتوي على ملف PDF
     """
+    from reportlab.lib.pagesizes import A4, landscape
+    from reportlab.platypus import SimpleDocTemplate
+    from reportlab.lib.units import cm
     # تسجيل الخطوط
     register_fonts()
     
@@ -128,6 +179,8 @@ def create_data_table(headers, data, col_widths=None):
     Returns:
         كائن Table
     """
+    from reportlab.lib import colors
+    from reportlab.platypus import Table, TableStyle
     # تجهيز عناوين الأعمدة بالعربية
     headers_display = [arabic_text(h) for h in headers]
     
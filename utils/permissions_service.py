@@ -2,6 +2,7 @@
 نظام الصلاحيات المركزي
 ====================
 يوفر خدمات التحقق من الصلاحيات مع caching على مستوى request
+وبين الطلبات عبر services.user_cache (يُسقط تلقائياً عند تعديل المستخدم أو صلاحياته)
 """
 
 from functools import wraps
@@ -40,12 +41,9 @@ def get_user_permissions():
         }
         return g._user_permissions_cache
     
-    # جلب صلاحيات المستخدم من قاعدة البيانات
-    permissions_dict = {}
-    for user_perm in current_user.permissions:
-        permissions_dict[user_perm.module] = user_perm.permissions
-    
-    g._user_permissions_cache = permissions_dict
+    # صلاحيات المستخدم من ذاكرة المستخدمين (استعلام واحد عند أول طلب أو بعد تعديلها)
+    from services import user_cache
+    g._user_permissions_cache = user_cache.permissions(current_user._get_current_object())
     return g._user_permissions_cache
 
 
@@ -221,18 +219,21 @@ def can_manage(module):
     return has_permission(module, Permission.MANAGE)
 
 
+_PERMISSIONS_CONTEXT = {
+    'Module': Module,
+    'can_view': can_view,
+    'can_create': can_create,
+    'can_edit': can_edit,
+    'can_delete': can_delete,
+    'can_manage': can_manage,
+    'has_module_access': has_module_access,
+    'has_permission': has_permission
+}
+
+
 def get_permissions_context():
     """
     Context processor للـ Jinja templates
-    يُضاف في app.py
+    يُضاف في app.py (قاموس ثابت؛ الدوال تُقيّم عند استدعائها في القالب فقط)
     """
-    return {
-        'Module': Module,
-        'can_view': can_view,
-        'can_create': can_create,
-        'can_edit': can_edit,
-        'can_delete': can_delete,
-        'can_manage': can_manage,
-        'has_module_access': has_module_access,
-        'has_permission': has_permission
-    }
+    return _PERMISSIONS_CONTEXT
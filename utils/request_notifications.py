@@ -6,6 +6,7 @@ from datetime import datetime
 from typing import Optional, List, Dict
 from app import db
 from models import RequestNotification, EmployeeRequest, Employee
+from services import notification_hub
 
 logger = logging.getLogger(__name__)
 
@@ -241,13 +242,14 @@ class RequestNotificationService:
             True إذا نجحت العملية
         """
         try:
-            RequestNotification.query.filter_by(
+            updated = RequestNotification.query.filter_by(
                 employee_id=employee_id,
                 is_read=False
             ).update({
                 'is_read': True,
                 'read_at': datetime.utcnow()
             })
+            notification_hub.record_change(notification_hub.EMPLOYEE, employee_id, -updated)
             
             db.session.commit()
             
@@ -304,12 +306,8 @@ class RequestNotificationService:
             عدد الإشعارات غير المقروءة
         """
         try:
-            count = RequestNotification.query.filter_by(
-                employee_id=employee_id,
-                is_read=False
-            ).count()
-            
-            return count
+            # من ذاكرة مركز الإشعارات؛ يُحدَّث عند الإنشاء والقراءة والحذف
+            return notification_hub.unread_count(notification_hub.EMPLOYEE, employee_id)
             
         except Exception as e:
             logger.error(f"خطأ في حساب الإشعارات غير المقروءة: {e}")
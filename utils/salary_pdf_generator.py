@@ -5,7 +5,8 @@
 # salary_pdf_generator.py
 from fpdf import FPDF
 from datetime import datetime
-import arabic_reshaper
+from utils.lazy_imports import lazy_import
+arabic_reshaper = lazy_import('arabic_reshaper')
 from bidi.algorithm import get_display
 import os
 from io import BytesIO
@@ -1,14 +1,9 @@
 from io import BytesIO
-from reportlab.lib.pagesizes import A4, landscape
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
-from reportlab.lib.styles import getSampleStyleSheet
+from utils.lazy_imports import lazy_import
+arabic_reshaper = lazy_import('arabic_reshaper')
 
-from reportlab.lib import colors
 from reportlab.pdfbase import pdfmetrics
 from reportlab.pdfbase.ttfonts import TTFont
-from reportlab.lib.units import inch
-import arabic_reshaper
-from bidi.algorithm import get_display
 from datetime import datetime
 
 # --- !!! هام جداً !!! ---
@@ -32,6 +27,7 @@ except Exception as e:
 
 def arabic_text(text):
     """يعالج النص العربي للعرض الصحيح في PDF."""
+    from bidi.algorithm import get_display
     if not text:
         return ""
     reshaped_text = arabic_reshaper.reshape(str(text))
@@ -39,6 +35,11 @@ def arabic_text(text):
     return bidi_text
 
 def generate_salary_report_pdf(salaries, report_params=None):
+    from reportlab.lib.pagesizes import A4, landscape
+    from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
+    from reportlab.lib.styles import getSampleStyleSheet
+    from reportlab.lib import colors
+    from reportlab.lib.units import inch
     buffer = BytesIO()
     doc = SimpleDocTemplate(buffer, pagesize=landscape(A4),
                             rightMargin=0.5*inch, leftMargin=0.5*inch,
@@ -11,7 +11,7 @@ except Exception as e:
     client = None
     STORAGE_AVAILABLE = False
 
-def upload_image(file_data, folder_name, filename):
+def upload_image(file_data, folder_name, filename, max_bytes=None):
     """
     رفع صورة وحفظها محلياً في static/uploads
     
@@ -19,22 +19,35 @@ def upload_image(file_data, folder_name, filename):
         file_data: البيانات الثنائية للملف (bytes أو file-like object)
         folder_name: اسم المجلد (مثل: safety_checks, properties, employees)
         filename: اسم الملف
+        max_bytes: الحد الأقصى للحجم (اختياري)؛ عند تجاوزه يُرفع ValueError
     
     Returns:
         str: المسار الكامل للملف المحلي
     """
-    # تحضير البيانات
-    if hasattr(file_data, 'read'):
-        file_bytes = file_data.read()
-    else:
-        file_bytes = file_data
-    
     # الحفظ المحلي (الطريقة الأساسية الآن)
     local_path = os.path.join('static', 'uploads', folder_name, filename)
     os.makedirs(os.path.dirname(local_path), exist_ok=True)
     
+    if not hasattr(file_data, 'read'):
+        file_data = io.BytesIO(file_data)
+    source = getattr(file_data, 'stream', file_data)
+    
+    # نسخ على دفعات بدلاً من قراءة الملف كاملاً في الذاكرة
+    written = 0
     with open(local_path, 'wb') as f:
-        f.write(file_bytes)
+        while True:
+            chunk = source.read(1024 * 1024)
+            if not chunk:
+                break
+            written += len(chunk)
+            if max_bytes is not None and written > max_bytes:
+                break
+            f.write(chunk)
+    
+    if max_bytes is not None and written > max_bytes:
+        # ملف مرفوض وليس ملفاً محفوظاً، فيُزال الجزء المكتوب
+        os.remove(local_path)
+        raise ValueError(f"حجم الملف يتجاوز الحد المسموح ({max_bytes // (1024 * 1024)}MB)")
     
     return f'static/uploads/{folder_name}/{filename}'
 
@@ -91,6 +104,41 @@ def download_image(object_key):
         # فشل Object Storage، والملف المحلي غير موجود
         return None
 
+# مجلد النسخ المحلية من ملفات Object Storage
+STORAGE_CACHE_DIR = os.path.join('instance', 'storage_cache')
+
+
+def cache_object_locally(object_key):
+    """
+    تنزيل ملف من Object Storage إلى مجلد محلي مرة واحدة لتقديمه من القرص لاحقاً
+    
+    Args:
+        object_key: مسار الملف في Object Storage
+    
+    Returns:
+        str: مجلد النسخ المحلية إذا توفر الملف، أو None
+    """
+    if not STORAGE_AVAILABLE or client is None:
+        return None
+    
+    local_path = os.path.abspath(os.path.join(STORAGE_CACHE_DIR, object_key))
+    if not local_path.startswith(os.path.abspath(STORAGE_CACHE_DIR) + os.sep):
+        return None
+    if os.path.exists(local_path):
+        return STORAGE_CACHE_DIR
+    
+    os.makedirs(os.path.dirname(local_path), exist_ok=True)
+    tmp_path = f"{local_path}.{os.getpid()}.tmp"
+    try:
+        client.download_to_filename(object_key, tmp_path)
+        os.replace(tmp_path, local_path)
+        return STORAGE_CACHE_DIR
+    except Exception:
+        return None
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
 def delete_image(object_key):
     """
     حذف صورة من Replit Object Storage أو من النظام المحلي
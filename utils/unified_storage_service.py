@@ -21,10 +21,7 @@ class UnifiedStorageService:
         self.vehicles_folder_id = None
         
     def _get_or_create_employees_folder(self) -> Optional[str]:
-        """الحصول على مجلد الموظفين في Shared Drive"""
-        if self.employees_folder_id:
-            return self.employees_folder_id
-            
+        """الحصول على مجلد الموظفين في Shared Drive (المعرف من ذاكرة المجلدات المشتركة)"""
         if not self.drive_service.is_configured():
             return None
             
@@ -44,10 +41,7 @@ class UnifiedStorageService:
             return None
     
     def _get_or_create_vehicles_folder(self) -> Optional[str]:
-        """الحصول على مجلد السيارات في Shared Drive"""
-        if self.vehicles_folder_id:
-            return self.vehicles_folder_id
-            
+        """الحصول على مجلد السيارات في Shared Drive (المعرف من ذاكرة المجلدات المشتركة)"""
         if not self.drive_service.is_configured():
             return None
             
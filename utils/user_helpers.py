@@ -425,12 +425,9 @@ def check_module_access(user: User, module: Module, permission: int = Permission
     if user.role == UserRole.ADMIN:
         return True
     
-    # البحث عن صلاحيات الوحدة
-    for user_permission in user.permissions:
-        if user_permission.module == module:
-            return bool(user_permission.permissions & permission)
-    
-    return False
+    # البحث عن صلاحيات الوحدة (من ذاكرة المستخدمين)
+    from services import user_cache
+    return bool(user_cache.permissions(user).get(module, 0) & permission)
 
 def require_module_access(module: Module, permission: int = Permission.VIEW):
     """
@@ -5,18 +5,13 @@
 import os
 from io import BytesIO
 from datetime import datetime
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import A4
-from reportlab.lib import colors
-from reportlab.platypus import Table, TableStyle
-from reportlab.lib.units import inch
-from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.ttfonts import TTFont
-import arabic_reshaper
-from bidi.algorithm import get_display
+from utils.lazy_imports import lazy_import
+arabic_reshaper = lazy_import('arabic_reshaper')
 
 def setup_arabic_font():
     """إعداد الخط العربي"""
+    from reportlab.pdfbase import pdfmetrics
+    from reportlab.pdfbase.ttfonts import TTFont
     try:
         font_path = os.path.join(os.path.dirname(__file__), '..', 'Cairo.ttf')
         if os.path.exists(font_path):
@@ -30,6 +25,7 @@ def setup_arabic_font():
 
 def process_arabic_text(text):
     """معالجة النص العربي للعرض الصحيح"""
+    from bidi.algorithm import get_display
     if not text:
         return ""
     
@@ -46,6 +42,11 @@ def create_vehicle_handover_pdf(handover_data):
     """
     إنشاء PDF عربي لتسليم المركبة
     """
+    from reportlab.pdfgen import canvas
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib import colors
+    from reportlab.platypus import Table, TableStyle
+    from reportlab.lib.units import inch
     try:
         print("Starting Arabic handover PDF generation...")
         
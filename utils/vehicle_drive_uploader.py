@@ -1,9 +1,9 @@
 """
 نظام الرفع التلقائي لملفات السيارات إلى Google Drive
-يعمل في الخلفية دون التأثير على العمليات الحالية
+يعمل في الخلفية دون التأثير على العمليات الحالية: الملفات تُضاف إلى قائمة المزامنة
+(services/drive_sync.py) وحقول drive_* في السجل تُحدَّث عند اكتمال رفعها
 """
 import os
-import json
 import logging
 from datetime import datetime
 from typing import Optional, List
@@ -11,6 +11,45 @@ from utils.google_drive_service import drive_service
 
 logger = logging.getLogger(__name__)
 
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TEMP_DIR = os.path.join(PROJECT_ROOT, 'instance', 'drive_sync_tmp')
+
+
+def _queue_operation(record, target_type, plate_number, operation_type, operation_date,
+                     pdf_path: Optional[str] = None, image_paths: Optional[List[str]] = None,
+                     temp_paths: Optional[List[str]] = None):
+    """
+    إضافة ملفات عملية السيارة إلى قائمة المزامنة
+    البنية: نُظم / [رقم اللوحة] / [نوع العملية] / [التاريخ والوقت]
+    """
+    from app import db
+    from services import drive_sync
+
+    if operation_date is None:
+        operation_date = datetime.now()
+    folder_path = [plate_number, operation_type, operation_date.strftime("%Y-%m-%d_%H-%M-%S")]
+    temp_paths = set(temp_paths or [])
+
+    files = [(pdf_path, 'pdf')] if pdf_path and os.path.exists(pdf_path) else []
+    files += [(path, 'image') for path in image_paths or [] if os.path.exists(path)]
+    if not files:
+        return 0
+
+    # السجل الجديد يحتاج معرفاً قبل ربط ملفاته
+    db.session.flush()
+    for path, role in files:
+        drive_sync.enqueue(
+            local_path=os.path.relpath(os.path.abspath(path), PROJECT_ROOT),
+            folder_path=folder_path,
+            target_type=target_type,
+            target_id=record.id,
+            role=role,
+            delete_after=path in temp_paths
+        )
+    record.drive_upload_status = 'pending'
+    logger.info(f"تمت إضافة {len(files)} ملف من {operation_type} - {plate_number} إلى قائمة المزامنة")
+    return len(files)
+
 
 class VehicleDriveUploader:
     """مدير الرفع التلقائي لملفات السيارات"""
@@ -43,33 +82,12 @@ class VehicleDriveUploader:
                 if os.path.exists(img_path):
                     image_paths.append(img_path)
             
-            # رفع إلى Google Drive
-            result = drive_service.upload_vehicle_operation(
-                vehicle_plate=plate_number,
-                operation_type=operation_type,
-                pdf_path=pdf_path,
-                image_paths=image_paths if image_paths else None,
-                operation_date=workshop_record.entry_date
+            # إضافة إلى قائمة المزامنة
+            _queue_operation(
+                workshop_record, 'vehicle_workshop', plate_number, operation_type,
+                workshop_record.entry_date, pdf_path=pdf_path, image_paths=image_paths
             )
             
-            if result:
-                # تحديث السجل بروابط Google Drive
-                workshop_record.drive_folder_id = result.get('folder_id')
-                if result.get('pdf_info'):
-                    workshop_record.drive_pdf_link = result['pdf_info'].get('web_view_link')
-                
-                if result.get('images_info'):
-                    workshop_record.drive_images_links = json.dumps([
-                        img.get('web_view_link') for img in result['images_info']
-                    ])
-                
-                workshop_record.drive_upload_status = 'success'
-                workshop_record.drive_uploaded_at = datetime.utcnow()
-                
-                logger.info(f"تم رفع سجل الورشة {workshop_record.id} بنجاح")
-            else:
-                workshop_record.drive_upload_status = 'failed'
-                
         except Exception as e:
             logger.error(f"خطأ في رفع سجل الورشة: {e}")
             workshop_record.drive_upload_status = 'failed'
@@ -106,33 +124,12 @@ class VehicleDriveUploader:
                 if full_path and os.path.exists(full_path):
                     image_paths.append(full_path)
             
-            # رفع إلى Google Drive
-            result = drive_service.upload_vehicle_operation(
-                vehicle_plate=plate_number,
-                operation_type=operation_type,
-                pdf_path=pdf_path,
-                image_paths=image_paths if image_paths else None,
-                operation_date=handover_record.handover_date
+            # إضافة إلى قائمة المزامنة
+            _queue_operation(
+                handover_record, 'vehicle_handover', plate_number, operation_type,
+                handover_record.handover_date, pdf_path=pdf_path, image_paths=image_paths
             )
             
-            if result:
-                # تحديث السجل بروابط Google Drive
-                handover_record.drive_folder_id = result.get('folder_id')
-                if result.get('pdf_info'):
-                    handover_record.drive_pdf_link = result['pdf_info'].get('web_view_link')
-                
-                if result.get('images_info'):
-                    handover_record.drive_images_links = json.dumps([
-                        img.get('web_view_link') for img in result['images_info']
-                    ])
-                
-                handover_record.drive_upload_status = 'success'
-                handover_record.drive_uploaded_at = datetime.utcnow()
-                
-                logger.info(f"تم رفع سجل التسليم/الاستلام {handover_record.id} بنجاح")
-            else:
-                handover_record.drive_upload_status = 'failed'
-                
         except Exception as e:
             logger.error(f"خطأ في رفع سجل التسليم/الاستلام: {e}")
             handover_record.drive_upload_status = 'failed'
@@ -152,7 +149,7 @@ class VehicleDriveUploader:
         
         try:
             from utils.storage_helper import download_image
-            import tempfile
+            import uuid
             
             # جمع بيانات العملية
             plate_number = safety_check.vehicle_plate_number
@@ -162,6 +159,7 @@ class VehicleDriveUploader:
             
             # جمع الصور
             image_paths = []
+            temp_paths = []
             for img in safety_check.safety_images:
                 if not img.image_path:
                     continue
@@ -180,11 +178,13 @@ class VehicleDriveUploader:
                     try:
                         image_data = download_image(img.image_path)
                         if image_data:
-                            # إنشاء ملف مؤقت
-                            with tempfile.NamedTemporaryFile(suffix='.jpg', delete=False) as tmp:
+                            # حفظ نسخة مؤقتة حتى يرفعها عامل المزامنة
+                            os.makedirs(TEMP_DIR, exist_ok=True)
+                            tmp_path = os.path.join(TEMP_DIR, f"{uuid.uuid4().hex}.jpg")
+                            with open(tmp_path, 'wb') as tmp:
                                 tmp.write(image_data)
-                                tmp_path = tmp.name
                             image_paths.append(tmp_path)
+                            temp_paths.append(tmp_path)
                             logger.info(f"تم تحميل صورة من Object Storage: {img.image_path}")
                         else:
                             logger.warning(f"لم يتم العثور على صورة: {img.image_path}")
@@ -203,42 +203,13 @@ class VehicleDriveUploader:
             
             logger.info(f"جاري رفع فحص السلامة {safety_check.id} - {len(image_paths)} صورة، PDF: {pdf_path is not None}")
             
-            # رفع إلى Google Drive
-            result = drive_service.upload_vehicle_operation(
-                vehicle_plate=plate_number,
-                operation_type=operation_type,
-                pdf_path=pdf_path,
-                image_paths=image_paths if image_paths else None,
-                operation_date=safety_check.inspection_date
+            # إضافة إلى قائمة المزامنة (الصور المحملة مؤقتاً تُحذف بعد رفعها)
+            _queue_operation(
+                safety_check, 'vehicle_safety', plate_number, operation_type,
+                safety_check.inspection_date, pdf_path=pdf_path, image_paths=image_paths,
+                temp_paths=temp_paths
             )
             
-            # تنظيف الملفات المؤقتة
-            for img_path in image_paths:
-                if img_path.startswith('/tmp'):
-                    try:
-                        os.remove(img_path)
-                    except:
-                        pass
-            
-            if result:
-                # تحديث السجل بروابط Google Drive
-                safety_check.drive_folder_id = result.get('folder_id')
-                if result.get('pdf_info'):
-                    safety_check.drive_pdf_link = result['pdf_info'].get('web_view_link')
-                
-                if result.get('images_info'):
-                    safety_check.drive_images_links = json.dumps([
-                        img.get('web_view_link') for img in result['images_info']
-                    ])
-                
-                safety_check.drive_upload_status = 'success'
-                safety_check.drive_uploaded_at = datetime.utcnow()
-                
-                logger.info(f"تم رفع فحص السلامة {safety_check.id} بنجاح - Folder ID: {result.get('folder_id')}")
-            else:
-                safety_check.drive_upload_status = 'failed'
-                logger.warning(f"فشل رفع فحص السلامة {safety_check.id} - لم يتم استلام نتيجة من Google Drive")
-                
         except Exception as e:
             logger.error(f"خطأ في رفع فحص السلامة: {e}", exc_info=True)
             safety_check.drive_upload_status = 'failed'
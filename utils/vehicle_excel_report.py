@@ -1,5 +1,6 @@
 from datetime import datetime
-import pandas as pd
+from utils.lazy_imports import lazy_import
+pd = lazy_import('pandas')
 import io
 
 def generate_complete_vehicle_excel_report(vehicle, rental=None, workshop_records=None, documents=None, handovers=None, inspections=None):
@@ -8,15 +8,9 @@ import io
 import tempfile
 from datetime import datetime
 from flask import url_for
-from reportlab.lib import colors
-from reportlab.lib.pagesizes import A4, landscape
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, Image
-from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.ttfonts import TTFont
-from arabic_reshaper import reshape
+from utils.lazy_imports import lazy_import
+pd = lazy_import('pandas')
 from bidi.algorithm import get_display
-import pandas as pd
 from fpdf import FPDF
 
 # تعريف مسار المجلد الحالي
@@ -227,6 +221,10 @@ def export_workshop_records_pdf(vehicle, workshop_records):
     Returns:
         BytesIO: كائن بايت يحتوي على ملف PDF
     """
+    from reportlab.lib import colors
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+    from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, Image
     register_fonts()
     
     buffer = io.BytesIO()
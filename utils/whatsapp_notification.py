@@ -1,5 +1,4 @@
 import os
-from twilio.rest import Client
 from datetime import datetime
 
 # الحصول على بيانات الاعتماد من متغيرات البيئة
@@ -20,6 +19,7 @@ def send_salary_notification_whatsapp(employee, salary):
     Returns:
         Boolean: True إذا تم الإرسال بنجاح، False إذا فشل الإرسال
     """
+    from twilio.rest import Client
     try:
         # التحقق من وجود رقم هاتف للموظف
         if not employee.mobile:
@@ -82,6 +82,7 @@ def send_salary_deduction_notification_whatsapp(employee, salary, deduction_reas
     Returns:
         Boolean: True إذا تم الإرسال بنجاح، False إذا فشل الإرسال
     """
+    from twilio.rest import Client
     try:
         # التحقق من وجود رقم هاتف للموظف
         if not employee.mobile:
@@ -242,6 +243,7 @@ def send_vehicle_handover_whatsapp(handover, recipient_phone, message_text=None)
     Returns:
         Boolean: True إذا تم الإرسال بنجاح، False إذا فشل الإرسال
     """
+    from twilio.rest import Client
     try:
         # التحقق من وجود بيانات اعتماد Twilio
         if not TWILIO_ACCOUNT_SID or not TWILIO_AUTH_TOKEN or not TWILIO_PHONE_NUMBER: